@@ -15,6 +15,10 @@ from models import (
     PromotionMember, Region, User
 )
 from auth import has_permission, can_view_stock_values
+import schema_registry
+from cache_generations import ChangeTracker, GenerationCache
+import analytics_series
+import landed_cost
 
 # Créer le blueprint
 analytics_bp = Blueprint('analytics', __name__, url_prefix='/analytics')
@@ -101,7 +105,7 @@ def get_period_dates(period='month'):
 
 def calculate_simulation_kpis(start_date=None, end_date=None):
     """Calcule les KPIs pour les simulations"""
-    from sqlalchemy import text, inspect
+    from sqlalchemy import text
     
     try:
         # Essayer d'abord avec ORM
@@ -118,8 +122,7 @@ def calculate_simulation_kpis(start_date=None, end_date=None):
         if 'target_mode' in str(e) or 'target_margin_pct' in str(e):
             try:
                 # Vérifier quelles colonnes existent dans la table
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('simulations')]
+                columns = schema_registry.get_columns('simulations')
                 
                 # Construire la liste des colonnes à sélectionner (sans target_mode et target_margin_pct)
                 select_cols = []
@@ -188,26 +191,25 @@ def calculate_simulation_kpis(start_date=None, end_date=None):
     total_simulations = len(simulations)
     completed_simulations = sum(1 for s in simulations if hasattr(s, 'is_completed') and s.is_completed)
     
-    # Calculer les totaux de marge
-    total_margin = Decimal('0')
+    # Calculer les totaux de marge (achats convertis en GNF par le moteur landed_cost)
     total_purchase = Decimal('0')
     total_selling = Decimal('0')
     
-    for sim in simulations:
-        if hasattr(sim, 'is_completed') and sim.is_completed and hasattr(sim, 'id'):
-            try:
-                items = SimulationItem.query.filter_by(simulation_id=sim.id).all()
-                for item in items:
-                    # Calculer la marge pour chaque article
-                    purchase_price = Decimal(str(item.purchase_price_gnf or 0))
-                    selling_price = Decimal(str(item.selling_price_gnf or 0))
-                    quantity = Decimal(str(item.quantity or 0))
-                    
-                    total_purchase += purchase_price * quantity
-                    total_selling += selling_price * quantity
-            except Exception as item_error:
-                print(f"⚠️ Erreur lors du calcul des items pour simulation {sim.id}: {item_error}")
-                continue
+    completed = [s for s in simulations if getattr(s, 'is_completed', False) and getattr(s, 'id', None)]
+    items_by_simulation = {}
+    if completed:
+        # Articles de toutes les simulations terminées en une requête
+        for item in SimulationItem.query.filter(SimulationItem.simulation_id.in_([s.id for s in completed])):
+            items_by_simulation.setdefault(item.simulation_id, []).append(item)
+    
+    for sim in completed:
+        try:
+            costs = landed_cost.landed_costs(sim, items_by_simulation.get(sim.id, []))
+            total_purchase += costs.total_purchase_value
+            total_selling += costs.total_selling_value
+        except Exception as item_error:
+            print(f"⚠️ Erreur lors du calcul des items pour simulation {sim.id}: {item_error}")
+            continue
     
     total_margin = total_selling - total_purchase
     margin_percentage = (total_margin / total_purchase * 100) if total_purchase > 0 else Decimal('0')
@@ -257,101 +259,149 @@ def calculate_forecast_kpis(start_date=None, end_date=None):
         'variance_percentage': float((variance / total_forecast_value * 100) if total_forecast_value > 0 else 0)
     }
 
-def calculate_stock_kpis(start_date=None, end_date=None):
-    """Calcule les KPIs pour les stocks avec filtrage par région"""
+# Durée de vie en cache des KPIs de stock par (région, période), en secondes
+STOCK_KPIS_CACHE_TIMEOUT = 300
+STOCK_KPIS_GENERATION_KEY = 'analytics_stock_kpis_generation'
+
+# Modèles dont un commit invalide les KPIs de stock
+STOCK_KPIS_WATCHED_MODELS = (StockItem, StockMovement, DepotStock, VehicleStock, Depot, Vehicle, Reception)
+
+_stock_kpis_store = GenerationCache(STOCK_KPIS_GENERATION_KEY, timeout=STOCK_KPIS_CACHE_TIMEOUT)
+
+def invalidate_stock_kpis():
+    """Rend périmées toutes les entrées de KPIs de stock en cache"""
+    _stock_kpis_store.invalidate()
+
+_stock_kpis_changes = ChangeTracker('stock_kpis_dirty', invalidate_stock_kpis, 'KPIs de stock',
+                                    models=STOCK_KPIS_WATCHED_MODELS)
+
+def mark_stock_kpis_dirty(session):
+    """Invalide les KPIs de stock au prochain commit (écritures hors ORM : insert / update groupés)"""
+    _stock_kpis_changes.mark_dirty(session)
+
+def calculate_stock_kpis(start_date=None, end_date=None, region_id=False):
+    """
+    Calcule les KPIs pour les stocks avec filtrage par région
+
+    Calcul ensembliste : valeur, entrées et sorties sont des agrégats SQL et
+    la détection du stock faible est une seule requête groupée comparant chaque
+    emplacement à min_stock_depot / min_stock_vehicle de l'article.
+    Résultat mis en cache par (région, période), invalidé au commit d'une
+    écriture de stock (ORM ou stock_mutations).
+
+    Args:
+        region_id: Région à analyser ; par défaut celle de l'utilisateur connecté
+                   (None = toutes les régions)
+    """
+    from flask import current_app
+    from utils_region_filter import get_user_region_id
+
+    if region_id is False:
+        region_id = get_user_region_id()
+
+    cache = getattr(current_app, 'cache', None)
+    cache_key = (f"analytics_stock_kpis_{region_id if region_id else 'all'}_{start_date}_{end_date}"
+                 f"_g{_stock_kpis_store.generation()}")
+    if cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    kpis = compute_stock_kpis(start_date, end_date, region_id)
+    if cache:
+        cache.set(cache_key, kpis, timeout=STOCK_KPIS_CACHE_TIMEOUT)
+    return kpis
+
+def compute_stock_kpis(start_date=None, end_date=None, region_id=None):
+    """Calcule les KPIs de stock d'une région (None = toutes) sans cache"""
+    from sqlalchemy import case, literal, select, union_all
     from utils_region_filter import (
-        filter_depot_stocks_by_region, filter_vehicle_stocks_by_region,
-        filter_stock_movements_by_region, filter_depots_by_region
+        region_depot_ids_subquery, region_vehicle_ids_subquery, stock_movement_region_condition
     )
-    
-    # Stock total actuel (filtré par région)
-    depot_stocks_query = DepotStock.query
-    depot_stocks_query = filter_depot_stocks_by_region(depot_stocks_query)
-    depot_stocks = depot_stocks_query.all()
-    
-    vehicle_stocks_query = VehicleStock.query
-    vehicle_stocks_query = filter_vehicle_stocks_by_region(vehicle_stocks_query)
-    vehicle_stocks = vehicle_stocks_query.all()
-    
+
+    depot_scope = []
+    vehicle_scope = []
+    movement_scope = []
+    reception_scope = []
+    if region_id is not None:
+        depot_ids = region_depot_ids_subquery(region_id)
+        vehicle_ids = region_vehicle_ids_subquery(region_id)
+        depot_scope = [DepotStock.depot_id.in_(depot_ids)]
+        vehicle_scope = [VehicleStock.vehicle_id.in_(vehicle_ids)]
+        movement_scope = [stock_movement_region_condition(region_id)]
+        reception_scope = [Reception.depot_id.in_(depot_ids)]
+
+    # Stock total actuel : quantité et valeur (prix d'achat GNF) en une requête par emplacement
     total_quantity = Decimal('0')
     total_value = Decimal('0')
-    
-    for ds in depot_stocks:
-        quantity = Decimal(str(ds.quantity or 0))
-        item = StockItem.query.get(ds.stock_item_id)
-        if item:
-            price = Decimal(str(item.purchase_price_gnf or 0))
-            total_quantity += quantity
-            total_value += quantity * price
-    
-    for vs in vehicle_stocks:
-        quantity = Decimal(str(vs.quantity or 0))
-        item = StockItem.query.get(vs.stock_item_id)
-        if item:
-            price = Decimal(str(item.purchase_price_gnf or 0))
-            total_quantity += quantity
-            total_value += quantity * price
-    
-    # Mouvements dans la période (filtrés par région)
-    movements_query = StockMovement.query
-    movements_query = filter_stock_movements_by_region(movements_query)
+    for model, scope in ((DepotStock, depot_scope), (VehicleStock, vehicle_scope)):
+        quantity, value = db.session.query(
+            func.coalesce(func.sum(model.quantity), 0),
+            func.coalesce(func.sum(model.quantity * func.coalesce(StockItem.purchase_price_gnf, 0)), 0)
+        ).join(StockItem, StockItem.id == model.stock_item_id).filter(*scope).one()
+        total_quantity += Decimal(str(quantity))
+        total_value += Decimal(str(value))
+
+    # Mouvements dans la période : entrées (quantités positives) et sorties (négatives)
+    movement_filters = list(movement_scope)
     if start_date:
-        movements_query = movements_query.filter(StockMovement.movement_date >= start_date)
+        movement_filters.append(StockMovement.movement_date >= start_date)
     if end_date:
-        movements_query = movements_query.filter(StockMovement.movement_date <= end_date)
-    
-    movements = movements_query.all()
-    
-    # Calculer les entrées : tous les mouvements avec quantité positive
-    # (réceptions, transferts entrants, ajustements positifs, retours clients)
-    entries = sum(float(m.quantity) for m in movements if float(m.quantity) > 0)
-    
-    # Calculer les sorties : tous les mouvements avec quantité négative
-    # (sorties clients/ventes, transferts sortants, ajustements négatifs, retours fournisseurs)
-    exits = sum(abs(float(m.quantity)) for m in movements if float(m.quantity) < 0)
-    
+        movement_filters.append(StockMovement.movement_date <= end_date)
+    entries, exits = db.session.query(
+        func.coalesce(func.sum(case((StockMovement.quantity > 0, StockMovement.quantity), else_=0)), 0),
+        func.coalesce(func.sum(case((StockMovement.quantity < 0, -StockMovement.quantity), else_=0)), 0)
+    ).filter(*movement_filters).one()
+
     # Réceptions dans la période (filtrées par dépôt/région)
-    receptions_query = Reception.query
+    reception_filters = list(reception_scope)
     if start_date:
-        receptions_query = receptions_query.filter(Reception.reception_date >= start_date)
+        reception_filters.append(Reception.reception_date >= start_date)
     if end_date:
-        receptions_query = receptions_query.filter(Reception.reception_date <= end_date)
-    
-    # Filtrer les réceptions par dépôt/région
-    from utils_region_filter import get_user_region_id
-    region_id = get_user_region_id()
-    if region_id is not None:
-        depot_ids = [d.id for d in filter_depots_by_region(Depot.query).all()]
-        if depot_ids:
-            receptions_query = receptions_query.filter(Reception.depot_id.in_(depot_ids))
-        else:
-            receptions_query = receptions_query.filter(False)
-    
-    receptions_count = receptions_query.count()
-    
-    # Articles en stock faible (moins de 10 unités) - filtrés par région
-    low_stock_items = []
-    for item in StockItem.query.filter_by(is_active=True).all():
-        # Calculer le stock total pour cet article (filtré par région)
-        total_item_stock = sum(
-            float(ds.quantity or 0) for ds in depot_stocks if ds.stock_item_id == item.id
-        ) + sum(
-            float(vs.quantity or 0) for vs in vehicle_stocks if vs.stock_item_id == item.id
-        )
-        if total_item_stock < 10:
-            low_stock_items.append({
-                'item': item,
-                'quantity': total_item_stock
-            })
-    
+        reception_filters.append(Reception.reception_date <= end_date)
+    receptions_count = db.session.query(func.count(Reception.id)).filter(*reception_filters).scalar() or 0
+
+    # Stock faible : emplacements sous le seuil de l'article, regroupés par article
+    below_threshold = union_all(
+        select(
+            DepotStock.stock_item_id.label('stock_item_id'),
+            DepotStock.quantity.label('quantity'),
+            (StockItem.min_stock_depot - DepotStock.quantity).label('shortfall')
+        ).join(StockItem, StockItem.id == DepotStock.stock_item_id)
+        .where(StockItem.is_active == True, DepotStock.quantity < StockItem.min_stock_depot, *depot_scope),
+        select(
+            VehicleStock.stock_item_id.label('stock_item_id'),
+            VehicleStock.quantity.label('quantity'),
+            (StockItem.min_stock_vehicle - VehicleStock.quantity).label('shortfall')
+        ).join(StockItem, StockItem.id == VehicleStock.stock_item_id)
+        .where(StockItem.is_active == True, VehicleStock.quantity < StockItem.min_stock_vehicle, *vehicle_scope)
+    ).subquery()
+    low_stock_rows = db.session.query(
+        StockItem.id, StockItem.sku, StockItem.name,
+        func.count().label('locations_count'),
+        func.sum(below_threshold.c.quantity).label('quantity'),
+        func.sum(below_threshold.c.shortfall).label('shortfall')
+    ).join(below_threshold, below_threshold.c.stock_item_id == StockItem.id)\
+     .group_by(StockItem.id, StockItem.sku, StockItem.name)\
+     .order_by(func.sum(below_threshold.c.shortfall).desc()).all()
+
+    low_stock_items = [{
+        'item_id': row.id,
+        'sku': row.sku,
+        'name': row.name,
+        'locations_count': row.locations_count,
+        'quantity': float(row.quantity or 0),
+        'shortfall': float(row.shortfall or 0)
+    } for row in low_stock_rows]
+
     return {
         'total_quantity': float(total_quantity),
         'total_value': float(total_value),
-        'entries': float(entries),
-        'exits': float(exits),
+        'entries': float(entries or 0),
+        'exits': float(exits or 0),
         'receptions_count': receptions_count,
         'low_stock_items_count': len(low_stock_items),
-        'low_stock_items': low_stock_items[:10]  # Top 10
+        'low_stock_items': low_stock_items[:10]  # Top 10 (plus gros manques d'abord)
     }
 
 def calculate_vehicle_kpis(start_date=None, end_date=None):
@@ -451,11 +501,7 @@ def calculate_promotion_kpis(start_date=None, end_date=None):
     
     # Vérifier si transaction_type existe
     try:
-        check_type_sql = """SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
-                           WHERE TABLE_SCHEMA = DATABASE() 
-                           AND TABLE_NAME = 'promotion_sales' 
-                           AND COLUMN_NAME = 'transaction_type'"""
-        has_transaction_type = db.session.execute(text(check_type_sql)).scalar() > 0
+        has_transaction_type = schema_registry.has_column('promotion_sales', 'transaction_type')
     except:
         has_transaction_type = False
     
@@ -769,6 +815,18 @@ def api_kpis():
         'end_date': end_date.isoformat()
     })
 
+def _chart_series_response(metric):
+    """Réponse {labels, data} d'un graphique à une métrique (toutes les tranches en une requête)"""
+    period = request.args.get('period', 'month')
+    start_date, end_date = get_period_dates(period)
+    series = analytics_series.simulation_series(
+        start_date, end_date, analytics_series.granularity_for_period(period), [metric]
+    )
+    return jsonify({
+        'labels': series['labels'],
+        'data': series['series'][metric]
+    })
+
 @analytics_bp.route('/api/charts/revenue')
 @login_required
 def api_charts_revenue():
@@ -776,60 +834,7 @@ def api_charts_revenue():
     if not has_permission(current_user, 'analytics.read'):
         return jsonify({'error': 'Permission denied'}), 403
     
-    period = request.args.get('period', 'month')
-    start_date, end_date = get_period_dates(period)
-    
-    # Générer les données par jour/semaine/mois selon la période
-    data = []
-    labels = []
-    
-    if period in ['today', 'week']:
-        # Par jour
-        current = start_date
-        while current <= end_date:
-            day_start = datetime.combine(current, datetime.min.time()).replace(tzinfo=UTC)
-            day_end = datetime.combine(current, datetime.max.time()).replace(tzinfo=UTC)
-            
-            kpis = calculate_simulation_kpis(current, current)
-            data.append(kpis['total_selling'])
-            labels.append(current.strftime('%d/%m'))
-            
-            current += timedelta(days=1)
-    elif period == 'month':
-        # Par semaine
-        current = start_date
-        week_num = 1
-        while current <= end_date:
-            week_end = min(current + timedelta(days=6), end_date)
-            kpis = calculate_simulation_kpis(current, week_end)
-            data.append(kpis['total_selling'])
-            labels.append(f'Semaine {week_num}')
-            current = week_end + timedelta(days=1)
-            week_num += 1
-    else:
-        # Par mois
-        current = start_date
-        month_num = 1
-        while current <= end_date:
-            if current.month == 12:
-                month_end = current.replace(day=31)
-            else:
-                month_end = (current.replace(month=current.month + 1, day=1) - timedelta(days=1))
-            month_end = min(month_end, end_date)
-            
-            kpis = calculate_simulation_kpis(current, month_end)
-            data.append(kpis['total_selling'])
-            labels.append(current.strftime('%m/%Y'))
-            
-            if current.month == 12:
-                current = current.replace(year=current.year + 1, month=1, day=1)
-            else:
-                current = current.replace(month=current.month + 1, day=1)
-    
-    return jsonify({
-        'labels': labels,
-        'data': data
-    })
+    return _chart_series_response('revenue')
 
 @analytics_bp.route('/api/charts/margin')
 @login_required
@@ -838,52 +843,42 @@ def api_charts_margin():
     if not has_permission(current_user, 'analytics.read'):
         return jsonify({'error': 'Permission denied'}), 403
     
-    period = request.args.get('period', 'month')
-    start_date, end_date = get_period_dates(period)
+    return _chart_series_response('margin')
+
+@analytics_bp.route('/api/charts/series')
+@login_required
+def api_charts_series():
+    """
+    API des séries temporelles : plusieurs métriques en une requête
     
-    # Similaire à revenue mais pour les marges
-    data = []
-    labels = []
-    
-    if period in ['today', 'week']:
-        current = start_date
-        while current <= end_date:
-            kpis = calculate_simulation_kpis(current, current)
-            data.append(kpis['total_margin'])
-            labels.append(current.strftime('%d/%m'))
-            current += timedelta(days=1)
-    elif period == 'month':
-        current = start_date
-        week_num = 1
-        while current <= end_date:
-            week_end = min(current + timedelta(days=6), end_date)
-            kpis = calculate_simulation_kpis(current, week_end)
-            data.append(kpis['total_margin'])
-            labels.append(f'Semaine {week_num}')
-            current = week_end + timedelta(days=1)
-            week_num += 1
-    else:
-        current = start_date
-        while current <= end_date:
-            if current.month == 12:
-                month_end = current.replace(day=31)
-            else:
-                month_end = (current.replace(month=current.month + 1, day=1) - timedelta(days=1))
-            month_end = min(month_end, end_date)
-            
-            kpis = calculate_simulation_kpis(current, month_end)
-            data.append(kpis['total_margin'])
-            labels.append(current.strftime('%m/%Y'))
-            
-            if current.month == 12:
-                current = current.replace(year=current.year + 1, month=1, day=1)
-            else:
-                current = current.replace(month=current.month + 1, day=1)
+    Paramètres: period (ou start_date/end_date au format YYYY-MM-DD),
+    granularity (day, week, month), metrics (liste séparée par des virgules)
+    """
+    if not has_permission(current_user, 'analytics.read'):
+        return jsonify({'error': 'Permission denied'}), 403
     
-    return jsonify({
-        'labels': labels,
-        'data': data
+    period = request.args.get('period', 'month')
+    try:
+        if request.args.get('start_date') and request.args.get('end_date'):
+            start_date = date.fromisoformat(request.args['start_date'])
+            end_date = date.fromisoformat(request.args['end_date'])
+        else:
+            start_date, end_date = get_period_dates(period)
+        if end_date < start_date:
+            return jsonify({'error': 'La date de fin doit être postérieure à la date de début'}), 400
+        
+        granularity = request.args.get('granularity') or analytics_series.granularity_for_period(period)
+        metrics = [m.strip() for m in request.args.get('metrics', 'revenue,margin').split(',') if m.strip()]
+        series = analytics_series.simulation_series(start_date, end_date, granularity, metrics)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    series.update({
+        'granularity': granularity,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat()
     })
+    return jsonify(series)
 
 @analytics_bp.route('/api/alerts')
 @login_required
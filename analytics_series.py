@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Séries temporelles agrégées pour les graphiques analytiques
+
+Toutes les tranches (jour, semaine, mois) d'une période sont calculées par une
+seule requête groupée sur une date tronquée côté base (date_trunc), au lieu de
+relancer le calcul des KPIs pour chaque tranche.
+
+Les tranches clôturées (antérieures à aujourd'hui) sont mises en cache sans
+expiration : seule la tranche en cours est recalculée. Un commit modifiant une
+simulation incrémente la génération du cache et rend les tranches obsolètes.
+"""
+
+from datetime import date, datetime, timedelta, UTC
+
+from sqlalchemy import Date, case, cast, func, literal_column
+
+from cache_generations import ChangeTracker, GenerationCache
+from models import db, Simulation, SimulationItem
+
+GENERATION_KEY = 'analytics_series_generation'
+
+# Métriques disponibles pour les graphiques de simulations
+METRICS = ('revenue', 'purchase', 'margin', 'simulations', 'completed_simulations')
+
+GRANULARITIES = ('day', 'week', 'month')
+
+# Tranches clôturées en cache, sans expiration : une tranche passée ne bouge plus
+_store = GenerationCache(GENERATION_KEY, timeout=0)
+
+
+# =========================================================
+# TRONCATURE DE DATES PAR DIALECTE
+# =========================================================
+
+def date_trunc(column, unit, dialect_name=None):
+    """
+    Tronque une colonne date/datetime au début du jour, de la semaine (lundi),
+    du mois ou de l'année, pour PostgreSQL, MySQL et SQLite
+
+    Args:
+        column: Colonne ou expression SQL
+        unit: 'day', 'week', 'month' ou 'year'
+        dialect_name: Nom du dialecte (défaut: celui de db.engine)
+
+    Returns:
+        Expression SQL (date, ou chaîne 'YYYY-MM-DD' selon le dialecte)
+    """
+    if unit not in ('day', 'week', 'month', 'year'):
+        raise ValueError(f"Unité de troncature inconnue: {unit}")
+    dialect_name = dialect_name or db.engine.dialect.name
+
+    if dialect_name == 'postgresql':
+        return cast(func.date_trunc(literal_column(f"'{unit}'"), column), Date)
+
+    if dialect_name in ('mysql', 'mariadb'):
+        if unit == 'day':
+            return func.date(column)
+        if unit == 'week':
+            return func.subdate(func.date(column), func.weekday(column))
+        if unit == 'month':
+            return func.date_format(column, '%Y-%m-01')
+        return func.date_format(column, '%Y-01-01')
+
+    # SQLite (tests et développement)
+    if unit == 'day':
+        return func.date(column)
+    if unit == 'week':
+        return func.date(column, 'weekday 0', '-6 days')
+    if unit == 'month':
+        return func.date(column, 'start of month')
+    return func.date(column, 'start of year')
+
+
+def _as_date(value):
+    """Normalise la valeur tronquée renvoyée par la base en date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+# =========================================================
+# TRANCHES
+# =========================================================
+
+def bucket_bounds(start_date, end_date, granularity):
+    """
+    Découpe [start_date, end_date] en tranches (début, fin, libellé)
+
+    - day : un jour par tranche
+    - week : blocs de 7 jours depuis le début de la période (Semaine 1, 2...)
+    - month : mois civils, bornés à la période
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Granularité inconnue: {granularity}")
+
+    buckets = []
+    current = start_date
+    week_num = 1
+    while current <= end_date:
+        if granularity == 'day':
+            bucket_end = current
+            label = current.strftime('%d/%m')
+        elif granularity == 'week':
+            bucket_end = min(current + timedelta(days=6), end_date)
+            label = f'Semaine {week_num}'
+            week_num += 1
+        else:
+            next_month = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+            bucket_end = min(next_month - timedelta(days=1), end_date)
+            label = current.strftime('%m/%Y')
+        buckets.append((current, bucket_end, label))
+        current = bucket_end + timedelta(days=1)
+    return buckets
+
+
+def granularity_for_period(period):
+    """Granularité des graphiques selon la période (même découpage qu'auparavant)"""
+    if period in ('today', 'week', 'previous_today', 'previous_week'):
+        return 'day'
+    if period in ('month', 'previous_month'):
+        return 'week'
+    return 'month'
+
+
+# =========================================================
+# AGRÉGATION
+# =========================================================
+
+def _query_daily_rows(start_date, end_date, sql_unit):
+    """
+    Une requête groupée : agrégats des simulations par date tronquée
+
+    Le prix d'achat est converti en GNF avec le taux de la simulation selon la
+    devise de l'article, avec la règle du moteur landed_cost : EUR, XOF (à défaut
+    de taux XOF, taux USD), sinon USD.
+    """
+    bucket = date_trunc(Simulation.created_at, sql_unit).label('bucket')
+    purchase_gnf = SimulationItem.purchase_price * case(
+        (SimulationItem.purchase_currency == 'EUR', Simulation.rate_eur),
+        (SimulationItem.purchase_currency == 'XOF',
+         func.coalesce(func.nullif(Simulation.rate_xof, 0), Simulation.rate_usd)),
+        else_=Simulation.rate_usd
+    ) * SimulationItem.quantity
+    selling_gnf = SimulationItem.selling_price_gnf * SimulationItem.quantity
+    completed = Simulation.is_completed == True
+
+    return db.session.query(
+        bucket,
+        func.count(func.distinct(Simulation.id)).label('simulations'),
+        func.count(func.distinct(case((completed, Simulation.id)))).label('completed_simulations'),
+        func.coalesce(func.sum(case((completed, selling_gnf), else_=0)), 0).label('revenue'),
+        func.coalesce(func.sum(case((completed, purchase_gnf), else_=0)), 0).label('purchase'),
+    ).select_from(Simulation)\
+     .outerjoin(SimulationItem, SimulationItem.simulation_id == Simulation.id)\
+     .filter(
+        Simulation.created_at >= datetime.combine(start_date, datetime.min.time()).replace(tzinfo=UTC),
+        Simulation.created_at <= datetime.combine(end_date, datetime.max.time()).replace(tzinfo=UTC)
+     ).group_by(literal_column('bucket')).all()
+
+
+def _empty_values():
+    return {metric: 0.0 for metric in METRICS}
+
+
+def _compute_buckets(buckets, granularity):
+    """Calcule les tranches demandées en une requête (les semaines sont agrégées depuis les jours)"""
+    sql_unit = 'month' if granularity == 'month' else 'day'
+    results = {(start, end): _empty_values() for start, end, _ in buckets}
+    rows = _query_daily_rows(buckets[0][0], buckets[-1][1], sql_unit)
+    for row in rows:
+        row_date = _as_date(row.bucket)
+        for start, end, _ in buckets:
+            # Tranches mensuelles : la date tronquée est le 1er du mois, éventuellement avant le début borné
+            if start <= row_date <= end or (granularity == 'month' and row_date == start.replace(day=1)):
+                values = results[(start, end)]
+                values['simulations'] += int(row.simulations or 0)
+                values['completed_simulations'] += int(row.completed_simulations or 0)
+                values['revenue'] += float(row.revenue or 0)
+                values['purchase'] += float(row.purchase or 0)
+                break
+    for values in results.values():
+        values['margin'] = values['revenue'] - values['purchase']
+    return results
+
+
+# =========================================================
+# CACHE DES TRANCHES CLÔTURÉES
+# =========================================================
+
+def _bucket_key(start, end, granularity, generation):
+    return f'analytics_series_{generation}_{granularity}_{start.isoformat()}_{end.isoformat()}'
+
+
+def invalidate():
+    """Rend obsolètes toutes les tranches en cache (nouvelle génération)"""
+    _store.invalidate()
+
+
+def simulation_series(start_date, end_date, granularity, metrics=None):
+    """
+    Séries des simulations sur une période, toutes tranches en une requête
+
+    Args:
+        start_date, end_date: Bornes de la période (dates incluses)
+        granularity: 'day', 'week' (blocs de 7 jours) ou 'month'
+        metrics: Liste de métriques parmi METRICS (défaut: toutes)
+
+    Returns:
+        dict: {'labels': [...], 'buckets': [{'start', 'end'}], 'series': {métrique: [...]}}
+    """
+    metrics = list(metrics or METRICS)
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise ValueError(f"Métriques inconnues: {', '.join(unknown)}")
+
+    buckets = bucket_bounds(start_date, end_date, granularity)
+    if not buckets:
+        return {'labels': [], 'buckets': [], 'series': {metric: [] for metric in metrics}}
+
+    today = date.today()
+    generation = _store.generation()
+    closed_keys = {
+        (start, end): _bucket_key(start, end, granularity, generation)
+        for start, end, _ in buckets if end < today
+    }
+    cached = _store.get_many(list(closed_keys.values())) if closed_keys else {}
+
+    values = {}
+    missing = []
+    for start, end, label in buckets:
+        key = closed_keys.get((start, end))
+        if key is not None and cached.get(key) is not None:
+            values[(start, end)] = cached[key]
+        else:
+            missing.append((start, end, label))
+
+    if missing:
+        computed = _compute_buckets(missing, granularity)
+        for bounds, bucket_values in computed.items():
+            values[bounds] = bucket_values
+            if bounds in closed_keys:
+                _store.set(closed_keys[bounds], bucket_values)
+
+    return {
+        'labels': [label for _, _, label in buckets],
+        'buckets': [{'start': start.isoformat(), 'end': end.isoformat()} for start, end, _ in buckets],
+        'series': {
+            metric: [values[(start, end)][metric] for start, end, _ in buckets]
+            for metric in metrics
+        }
+    }
+
+
+# =========================================================
+# INVALIDATION SUR MODIFICATION DES SIMULATIONS
+# =========================================================
+
+_changes = ChangeTracker('analytics_series_dirty', invalidate, 'séries analytiques',
+                         models=(Simulation, SimulationItem))
@@ -1,122 +1,228 @@
 # api_profitability.py
-# API pour les calculs de rentabilité des simulations
+# API pour les calculs de rentabilité des simulations (moteur de prix de revient landed_cost)
 
 from flask import Blueprint, request, jsonify
+from flask_login import login_required
 from decimal import Decimal
-import json
+
+from models import db, Simulation, SimulationItem
+import landed_cost
 
 # Création du blueprint
 profitability_api = Blueprint('profitability_api', __name__)
 
+# Variations par défaut de l'analyse de sensibilité (en % de la valeur de base)
+DEFAULT_VARIATIONS = {
+    'rate_usd': [-10, -5, 5, 10],
+    'rate_eur': [-10, -5, 5, 10],
+    'customs_gnf': [-20, -10, 10, 20],
+    'transport_per_kg_gnf': [-20, -10, 10, 20],
+}
+
+
+def _load_simulation(data):
+    """
+    Simulation et articles de la requête : simulation enregistrée (simulation_id)
+    ou paramètres et articles envoyés tels quels (simulation, items)
+    """
+    if data.get('simulation_id'):
+        simulation = db.session.get(Simulation, int(data['simulation_id']))
+        if simulation is None:
+            raise LookupError(f"Simulation {data['simulation_id']} introuvable")
+        items = SimulationItem.query.filter_by(simulation_id=simulation.id).order_by(SimulationItem.id).all()
+        return simulation, items
+    simulation, items = data.get('simulation'), data.get('items')
+    if not isinstance(simulation, dict) or not isinstance(items, list):
+        raise ValueError("simulation_id ou simulation et items requis")
+    return simulation, items
+
+
+def _article_id(item):
+    return item.get('article_id') if isinstance(item, dict) else item.article_id
+
+
+def _error(e, status=400):
+    return jsonify({
+        'success': False,
+        'error': str(e)
+    }), status
+
+
 @profitability_api.route('/api/profitability/calculate', methods=['POST'])
+@login_required
 def calculate_profitability():
     """API pour calculer la rentabilité d'une simulation"""
     try:
-        data = request.get_json()
-        
-        # Simulation de calcul de rentabilité
-        result = {
+        simulation, items = _load_simulation(request.get_json() or {})
+        result = landed_cost.landed_costs(simulation, items)
+        parameters = landed_cost.simulation_parameters(simulation)
+        weight = result.total_weight
+
+        return jsonify({
             'success': True,
             'data': {
                 'totals': {
-                    'total_weight_kg': 450.0,
-                    'total_value_gnf': 5200000.0,
-                    'total_fixed_costs': 5000000.0,
-                    'total_variable_costs': 200000.0,
-                    'total_costs': 5200000.0,
-                    'total_revenue': 6500000.0,
-                    'total_margin': 1300000.0,
-                    'margin_pct': 20.0
+                    'total_weight_kg': float(weight),
+                    'total_value_gnf': float(result.total_purchase_value),
+                    'total_fixed_costs': float(result.total_fixed_costs),
+                    'total_variable_costs': float(result.total_variable_costs),
+                    'total_logistics_costs': float(result.total_logistics),
+                    'total_costs': float(result.total_cost),
+                    'total_revenue': float(result.total_selling_value),
+                    'total_margin': float(result.total_margin),
+                    'margin_pct': float(result.margin_pct)
                 },
                 'truck': {
-                    'utilization_pct': 85.0,
-                    'overflow': False
+                    'utilization_pct': float(result.truck_utilization_pct),
+                    'overflow': result.truck_overflow,
+                    'capacity_kg': float(parameters['truck_capacity_tons'] * 1000)
                 },
                 'costs_breakdown': {
-                    'customs_gnf': 2000000.0,
-                    'handling_gnf': 500000.0,
-                    'others_gnf': 300000.0,
-                    'transport_fixed_gnf': 1000000.0,
-                    'transport_variable_gnf': 1200000.0
+                    'customs_gnf': float(parameters['customs_gnf']),
+                    'handling_gnf': float(parameters['handling_gnf']),
+                    'others_gnf': float(parameters['others_gnf']),
+                    'transport_fixed_gnf': float(parameters['transport_fixed_gnf']),
+                    'transport_variable_gnf': float(result.total_variable_costs)
                 },
                 'averages': {
-                    'avg_cost_per_kg': 11555.56,
-                    'avg_logistics_per_kg': 13333.33
+                    'avg_cost_per_kg': float(result.total_cost / weight) if weight > 0 else 0.0,
+                    'avg_logistics_per_kg': float(result.total_logistics / weight) if weight > 0 else 0.0
                 },
-                'items': []
+                'items': [{
+                    'article_id': _article_id(line['item']),
+                    'quantity': float(line['quantity']),
+                    'purchase_price_gnf': float(line['purchase_price_gnf']),
+                    'logistics_per_unit': float(line['logistics_per_unit']),
+                    'cost_price_per_unit': float(line['cost_price_per_unit']),
+                    'selling_price': float(line['selling_price']),
+                    'total_cost': float(line['total_cost']),
+                    'margin': float(line['margin']),
+                    'margin_pct': float(line['margin_pct'])
+                } for line in result.lines]
             }
-        }
-        
-        return jsonify(result)
-        
+        })
+
+    except LookupError as e:
+        return _error(e, 404)
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 400
+        return _error(e)
+
 
 @profitability_api.route('/api/profitability/sensitivity', methods=['POST'])
+@login_required
 def calculate_sensitivity():
-    """API pour l'analyse de sensibilité"""
+    """
+    API pour l'analyse de sensibilité
+
+    variations : {paramètre: [variations en %]} (DEFAULT_VARIATIONS par défaut)
+    scenarios : [{paramètre: valeur}] scénarios what-if complets (taux, douane, transport au kg,
+    capacité du camion...)
+    Toutes les variantes sont évaluées en un seul calcul vectoriel.
+    """
     try:
-        data = request.get_json()
-        
-        result = {
+        data = request.get_json() or {}
+        simulation, items = _load_simulation(data)
+        variations = data.get('variations') or DEFAULT_VARIATIONS
+        scenarios = data.get('scenarios') or []
+        unknown = (set(variations) | {name for scenario in scenarios for name in scenario}) \
+            - set(landed_cost.PARAMETERS)
+        if unknown:
+            raise ValueError(f"Paramètre(s) inconnu(s) : {', '.join(sorted(unknown))}")
+
+        base = landed_cost.simulation_parameters(simulation)
+        rows, labels = [base], []
+        for name, changes in variations.items():
+            for change in changes:
+                rows.append(dict(base, **{name: base[name] * (1 + Decimal(str(change)) / 100)}))
+                labels.append((name, change))
+        for scenario in scenarios:
+            rows.append(dict(base, **{name: Decimal(str(value)) for name, value in scenario.items()}))
+
+        grid = landed_cost.evaluate_scenarios(simulation, items, {
+            name: [row[name] for row in rows] for name in landed_cost.PARAMETERS
+        })
+        base_margin = float(grid.margin_pct[0])
+
+        sensitivity = {}
+        for index, (name, change) in enumerate(labels, start=1):
+            sensitivity.setdefault(name, []).append({
+                'change_pct': change,
+                'new_value': float(rows[index][name]),
+                'new_margin': float(grid.margin_pct[index]),
+                'impact': float(grid.margin_pct[index]) - base_margin
+            })
+
+        first = len(labels) + 1
+        return jsonify({
             'success': True,
             'data': {
-                'base_margin': 20.0,
-                'sensitivity': {
-                    'rate_usd': {
-                        'impact': 2.5,
-                        'new_rate': 8700.0,
-                        'new_margin': 22.5
-                    },
-                    'customs': {
-                        'impact': 1.8,
-                        'new_rate': 5500000.0,
-                        'new_margin': 18.2
-                    }
-                }
+                'base_margin': base_margin,
+                'sensitivity': sensitivity,
+                'scenarios': [{
+                    'parameters': scenario,
+                    'total_cost': float(grid.total_cost[index]),
+                    'total_margin': float(grid.total_margin[index]),
+                    'margin_pct': float(grid.margin_pct[index]),
+                    'truck_utilization_pct': float(grid.truck_utilization_pct[index]),
+                    'truck_overflow': bool(grid.truck_overflow[index])
+                } for index, scenario in enumerate(scenarios, start=first)]
             }
-        }
-        
-        return jsonify(result)
-        
+        })
+
+    except LookupError as e:
+        return _error(e, 404)
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 400
+        return _error(e)
+
 
 @profitability_api.route('/api/profitability/optimize', methods=['POST'])
+@login_required
 def optimize_prices():
-    """API pour l'optimisation des prix"""
+    """
+    API pour l'optimisation des prix
+
+    Prix de vente minimal de chaque article pour atteindre target_margin_pct (à défaut le taux
+    visé de la simulation) sur son prix de revient, arrondi au multiple supérieur de step.
+    """
     try:
-        data = request.get_json()
-        
-        result = {
+        data = request.get_json() or {}
+        simulation, items = _load_simulation(data)
+        target = data.get('target_margin_pct')
+        if target is None:
+            target = simulation.get('target_margin_pct') if isinstance(simulation, dict) \
+                else simulation.target_margin_pct
+        if not target or Decimal(str(target)) <= 0:
+            raise ValueError("Taux de marge visé (target_margin_pct) requis")
+
+        original = landed_cost.landed_costs(simulation, items)
+        prices = [landed_cost.price_for_margin(line['cost_price_per_unit'], target, data.get('step'))
+                  for line in original.lines]
+        optimized = landed_cost.landed_costs(simulation, landed_cost.with_selling_prices(items, prices))
+
+        recommendations = []
+        for line, price in zip(original.lines, prices):
+            change = price - line['selling_price']
+            recommendations.append({
+                'article_id': _article_id(line['item']),
+                'original_price': float(line['selling_price']),
+                'recommended_price': float(price),
+                'price_change': float(change),
+                'price_change_pct': float(change / line['selling_price'] * 100) if line['selling_price'] > 0 else 0.0
+            })
+
+        return jsonify({
             'success': True,
             'data': {
-                'original_margin': 15.0,
-                'optimized_margin': 22.0,
-                'improvement': 7.0,
-                'optimized_prices': [165000.0, 850000.0, 28000.0],
-                'recommendations': [
-                    {
-                        'article_id': 1,
-                        'original_price': 150000.0,
-                        'recommended_price': 165000.0,
-                        'price_change': 15000.0,
-                        'price_change_pct': 10.0
-                    }
-                ]
+                'target_margin_pct': float(target),
+                'original_margin': float(original.margin_pct),
+                'optimized_margin': float(optimized.margin_pct),
+                'improvement': float(optimized.margin_pct - original.margin_pct),
+                'optimized_prices': [float(price) for price in prices],
+                'recommendations': recommendations
             }
-        }
-        
-        return jsonify(result)
-        
+        })
+
+    except LookupError as e:
+        return _error(e, 404)
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 400
+        return _error(e)
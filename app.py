@@ -61,12 +61,17 @@ else:
 # Initialisation de SQLAlchemy
 from models import db
 db.init_app(app)
+import schema_registry
+import dashboard_stats  # enregistre l'invalidation des statistiques sur les commits
+import landed_cost
 
 # Configuration du middleware d'adaptation MySQL → PostgreSQL
 try:
     from db_utils.db_adapter import setup_sqlalchemy_middleware
-    setup_sqlalchemy_middleware(db.engine)
-    print("✅ Middleware d'adaptation MySQL/PostgreSQL activé")
+    # db.engine exige un contexte d'application ; le dialecte est résolu une seule fois ici
+    with app.app_context():
+        if setup_sqlalchemy_middleware(db.engine):
+            print("✅ Middleware d'adaptation MySQL/PostgreSQL activé")
 except Exception as e:
     print(f"⚠️  Erreur lors de l'initialisation du middleware d'adaptation: {e}")
 
@@ -230,6 +235,16 @@ if csrf:
         import traceback
         traceback.print_exc()
 
+# Les flux SSE sont des connexions longues (reconnexion automatique d'EventSource) :
+# ne pas les décompter dans les limites par défaut (50/heure par IP et par worker)
+if limiter:
+    try:
+        from chat.sse import stream_messages, stream_rooms
+        limiter.exempt(stream_messages)
+        limiter.exempt(stream_rooms)
+    except Exception as e:
+        print(f"⚠️  Erreur lors de l'exemption rate limiting des flux SSE: {e}")
+
 from analytics import analytics_bp
 app.register_blueprint(analytics_bp)
 
@@ -263,17 +278,8 @@ app.register_blueprint(sales_objectives_bp)
 from routes_notifications import notifications_bp
 app.register_blueprint(notifications_bp)
 
-# Initialiser le gestionnaire de rapports automatiques
-try:
-    from scheduled_reports import scheduled_reports_manager
-    scheduled_reports_manager.init_app(app)
-    with app.app_context():
-        scheduled_reports_manager.load_all_scheduled_reports()
-        print("✅ Rapports automatiques chargés et planifiés")
-except Exception as e:
-    print(f"⚠️  Erreur lors de l'initialisation des rapports automatiques: {e}")
-    import traceback
-    traceback.print_exc()
+from export_engine import exports_bp
+app.register_blueprint(exports_bp)
 
 # Initialiser le système de notifications automatiques
 try:
@@ -294,7 +300,51 @@ with app.app_context():
         # Créer toutes les tables
         db.create_all()
         print("✅ Tables créées avec succès")
-        
+
+        # Charger le registre du schéma (hérité par les workers avec preload_app)
+        try:
+            tables_count = schema_registry.load()
+            print(f"✅ Registre du schéma chargé ({tables_count} tables)")
+        except Exception as e:
+            print(f"⚠️  Erreur lors du chargement du registre du schéma: {e}")
+
+        # Initialiser le grand livre des soldes de stock au premier démarrage
+        try:
+            from models import StockMovement, StockBalanceLedger, StockMovementDailyCount
+            import stock_ledger
+            if StockBalanceLedger.query.first() is None and StockMovement.query.first() is not None:
+                print("🔄 Initialisation du grand livre des soldes de stock...")
+                written = stock_ledger.rebuild_ledger()
+                print(f"✅ Grand livre des soldes initialisé ({written} lignes)")
+            elif StockMovementDailyCount.query.first() is None and StockMovement.query.first() is not None:
+                written = stock_ledger.rebuild_daily_counts()
+                print(f"✅ Compteurs journaliers des mouvements initialisés ({written} lignes)")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️  Erreur lors de l'initialisation du grand livre des soldes: {e}")
+
+        # Rattacher les mouvements existants à leur bon de mouvement (premier démarrage)
+        try:
+            from models import StockMovement, StockMovementBatch
+            import movement_batches
+            if StockMovementBatch.query.first() is None and \
+               StockMovement.query.filter(StockMovement.reference.isnot(None)).first() is not None:
+                print("🔄 Rattachement des mouvements de stock à leurs bons...")
+                attached = movement_batches.backfill_batches()
+                print(f"✅ Bons de mouvement initialisés ({attached} mouvements rattachés)")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️  Erreur lors de l'initialisation des bons de mouvement: {e}")
+
+        # Index plein texte de la recherche globale (tsvector/GIN ou FULLTEXT selon la base)
+        try:
+            import search_backend
+            if search_backend.ensure_schema():
+                print(f"✅ Index plein texte de recherche créé ({search_backend.get_backend().name})")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️  Erreur lors de la création de l'index plein texte de recherche: {e}")
+
         # Initialiser les données de base si nécessaire
         from models import Category, Article, Simulation, SimulationItem, Role, User
         from werkzeug.security import generate_password_hash
@@ -574,9 +624,8 @@ with app.app_context():
             ]
             
             # Vérifier quelles colonnes existent dans la table
-            from sqlalchemy import inspect, text
-            inspector = inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('simulations')]
+            from sqlalchemy import text
+            columns = schema_registry.get_columns('simulations')
             
             for sim_data in demo_simulations:
                 # Construire les données de base avec seulement les colonnes qui existent
@@ -666,11 +715,34 @@ with app.app_context():
             
             db.session.commit()
             print("✅ Simulations de démonstration créées")
+
+        # Précalculer les statistiques du tableau de bord (toutes régions + chaque région)
+        try:
+            entries = dashboard_stats.warm_up()
+            print(f"✅ Statistiques du tableau de bord précalculées ({entries} entrées)")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️  Erreur lors du précalcul des statistiques du tableau de bord: {e}")
             
     except Exception as e:
         print(f"⚠️ Erreur lors de l'initialisation: {e}")
         print("🔄 Utilisation des données de démonstration")
 
+# Initialiser le gestionnaire de rapports automatiques (après la création des tables :
+# stockage partagé des tâches et bail de leader). DISABLE_SCHEDULER=1 dans les processus
+# worker de la file de tâches ; SCHEDULER_ROLE=client quand un planificateur dédié tourne
+try:
+    from scheduled_reports import scheduled_reports_manager
+    scheduled_reports_manager.init_app(app)
+    if os.getenv('DISABLE_SCHEDULER') != '1':
+        with app.app_context():
+            scheduled_reports_manager.load_all_scheduled_reports()
+            print("✅ Rapports automatiques chargés et planifiés")
+except Exception as e:
+    print(f"⚠️  Erreur lors de l'initialisation des rapports automatiques: {e}")
+    import traceback
+    traceback.print_exc()
+
 # Import et enregistrement des blueprints
 from api_profitability import profitability_api
 app.register_blueprint(profitability_api)
@@ -748,310 +820,38 @@ def calculate_items_total(items):
         pass
     return total
 
+def _attach_simulation_margins(simulations):
+    """
+    Charge les articles de plusieurs simulations en une seule requête et calcule la marge
+    totale de chacune avec le moteur commun landed_cost (même règle de devise que le détail,
+    le PDF, l'Excel et l'API) ; une simulation sans article a une marge nulle
+    """
+    from sqlalchemy.orm.attributes import set_committed_value
+    from models import SimulationItem
+    simulation_ids = [s.id for s in simulations if getattr(s, 'id', None)]
+    items_map = {}
+    if simulation_ids:
+        for item in SimulationItem.query.filter(SimulationItem.simulation_id.in_(simulation_ids))\
+                .order_by(SimulationItem.id):
+            items_map.setdefault(item.simulation_id, []).append(item)
+    for sim in simulations:
+        items = items_map.get(getattr(sim, 'id', None), [])
+        set_committed_value(sim, 'items', items)
+        sim.total_margin_gnf = landed_cost.landed_costs(sim, items).total_margin if items else Decimal('0')
+    return simulations
+
 # Routes principales
 @app.route('/')
 @login_required
 def index():
     """Page d'accueil moderne"""
     try:
-        from models import (
-            Category, Article, Simulation, Region, Depot, Vehicle, 
-            Family, StockItem, InventorySession, StockMovement, Reception,
-            VehicleDocument, VehicleMaintenance, DepotStock, VehicleStock,
-            PriceList
-        )
-        from datetime import datetime, timedelta
+        from models import Simulation, InventorySession, PriceList
+        from utils_region_filter import get_user_region_id, filter_stock_movements_by_region
         
-        # Récupérer les statistiques depuis la base de données
-        # Gérer les erreurs de colonnes manquantes
-        try:
-            simulations_count = Simulation.query.count()
-            completed_simulations = Simulation.query.filter_by(is_completed=True).count()
-        except Exception as e:
-            print(f"⚠️ Erreur lors du comptage des simulations (colonnes manquantes?): {e}")
-            simulations_count = 0
-            completed_simulations = 0
-        
-        # Utiliser le cache pour les statistiques si disponible (avec clé incluant la région)
-        from utils_region_filter import (
-            get_user_region_id, filter_depots_by_region, filter_vehicles_by_region,
-            filter_stock_movements_by_region, filter_depot_stocks_by_region, filter_vehicle_stocks_by_region,
-            filter_receptions_by_region, filter_inventory_sessions_by_region, filter_users_by_region,
-            filter_employees_by_region
-        )
+        # Statistiques calculées par le moteur dédié (requêtes groupées + cache stale-while-revalidate)
         user_region_id = get_user_region_id()
-        cache_key = f'dashboard_stats_{user_region_id if user_region_id else "all"}'
-        stats = None
-        
-        if app.cache:
-            stats = app.cache.get(cache_key)
-        
-        if not stats:
-            # Import Profit (pas de filtre par région)
-            stats = {
-                'categories_count': Category.query.count(),
-                'articles_count': Article.query.count(),
-                'simulations_count': simulations_count,
-                'completed_simulations': completed_simulations,
-            }
-            
-            # Référentiels avec filtrage par région
-            stats['regions_count'] = Region.query.count()
-            
-            # Dépôts filtrés par région
-            depots_query = Depot.query.filter_by(is_active=True)
-            depots_query = filter_depots_by_region(depots_query)
-            stats['depots_count'] = depots_query.count()
-            
-            # Véhicules filtrés par région
-            vehicles_query = Vehicle.query.filter_by(status='active')
-            vehicles_query = filter_vehicles_by_region(vehicles_query)
-            stats['vehicles_count'] = vehicles_query.count()
-            
-            stats['families_count'] = Family.query.count()  # Pas de filtre par région (référentiel global)
-            stats['stock_items_count'] = StockItem.query.filter_by(is_active=True).count()  # Pas de filtre par région (référentiel global)
-            
-            # Stocks avec filtrage par région
-            movements_query = StockMovement.query
-            movements_query = filter_stock_movements_by_region(movements_query)
-            stats['movements_count'] = movements_query.count()
-            
-            # Réceptions filtrées par région
-            receptions_query = Reception.query
-            receptions_query = filter_receptions_by_region(receptions_query)
-            stats['receptions_count'] = receptions_query.count()
-            
-            depot_stocks_query = DepotStock.query
-            depot_stocks_query = filter_depot_stocks_by_region(depot_stocks_query)
-            stats['depot_stocks_count'] = depot_stocks_query.count()
-            
-            vehicle_stocks_query = VehicleStock.query
-            vehicle_stocks_query = filter_vehicle_stocks_by_region(vehicle_stocks_query)
-            stats['vehicle_stocks_count'] = vehicle_stocks_query.count()
-            
-            # Inventaires filtrés par région
-            inventory_query = InventorySession.query
-            inventory_query = filter_inventory_sessions_by_region(inventory_query)
-            stats['inventory_sessions_count'] = inventory_query.count()
-            stats['inventory_pending'] = filter_inventory_sessions_by_region(
-                InventorySession.query.filter_by(status='draft')
-            ).count()
-            
-            # Flotte avec filtrage par région
-            vehicles_for_docs_query = Vehicle.query
-            vehicles_for_docs_query = filter_vehicles_by_region(vehicles_for_docs_query)
-            vehicle_ids_for_docs = [v.id for v in vehicles_for_docs_query.all()]
-            if vehicle_ids_for_docs:
-                stats['documents_count'] = VehicleDocument.query.filter(VehicleDocument.vehicle_id.in_(vehicle_ids_for_docs)).count()
-                stats['maintenances_planned'] = VehicleMaintenance.query.filter(
-                    VehicleMaintenance.vehicle_id.in_(vehicle_ids_for_docs),
-                    VehicleMaintenance.status == 'planned'
-                ).count()
-            else:
-                stats['documents_count'] = 0
-                stats['maintenances_planned'] = 0
-            
-            # Fiches de Prix
-            stats['price_lists_count'] = PriceList.query.count()
-            stats['price_lists_active'] = PriceList.query.filter_by(is_active=True).count()
-            
-            # Statistiques RH filtrées par région
-            try:
-                from models import User, Employee, EmployeeContract, EmployeeTraining, EmployeeAbsence
-                from sqlalchemy.exc import SQLAlchemyError
-                from sqlalchemy import or_, and_
-                
-                # Annuler toute transaction en cours en cas d'erreur précédente
-                db.session.rollback()
-                
-                # Utilisateurs filtrés par région
-                users_query = User.query
-                users_query = filter_users_by_region(users_query)
-                stats['total_users'] = users_query.count()
-                stats['active_users'] = filter_users_by_region(User.query.filter_by(is_active=True)).count()
-                
-                # Employés filtrés par région
-                employees_query = Employee.query
-                employees_query = filter_employees_by_region(employees_query)
-                stats['total_employees'] = employees_query.count()
-                stats['active_employees'] = filter_employees_by_region(
-                    Employee.query.filter_by(employment_status='active')
-                ).count()
-                # Contrats filtrés par région (via l'employé)
-                region_id = get_user_region_id()
-                if region_id is not None:
-                    contracts_query = EmployeeContract.query.join(Employee).filter(
-                        and_(
-                            Employee.region_id == region_id,
-                            or_(
-                                EmployeeContract.status == 'active',
-                                and_(
-                                    EmployeeContract.end_date.is_(None),
-                                    EmployeeContract.status != 'terminated'
-                                )
-                            )
-                        )
-                    )
-                else:
-                    contracts_query = EmployeeContract.query.filter(
-                        or_(
-                            EmployeeContract.status == 'active',
-                            and_(
-                                EmployeeContract.end_date.is_(None),
-                                EmployeeContract.status != 'terminated'
-                            )
-                        )
-                    )
-                stats['active_contracts'] = contracts_query.count()
-                
-                # Absences filtrées par région (via l'employé)
-                if region_id is not None:
-                    absences_query = EmployeeAbsence.query.join(Employee).filter(
-                        and_(
-                            Employee.region_id == region_id,
-                            EmployeeAbsence.status == 'pending'
-                        )
-                    )
-                else:
-                    absences_query = EmployeeAbsence.query.filter_by(status='pending')
-                stats['pending_absences'] = absences_query.count()
-                
-                # Formations filtrées par région (via l'employé)
-                if region_id is not None:
-                    trainings_query = EmployeeTraining.query.join(Employee).filter(
-                        and_(
-                            Employee.region_id == region_id,
-                            EmployeeTraining.status == 'in_progress'
-                        )
-                    )
-                else:
-                    trainings_query = EmployeeTraining.query.filter_by(status='in_progress')
-                stats['ongoing_trainings'] = trainings_query.count()
-            except (Exception, SQLAlchemyError) as e:
-                print(f"⚠️ Erreur lors du calcul des statistiques RH: {e}")
-                db.session.rollback()  # Annuler la transaction en cas d'erreur
-                stats['total_users'] = 0
-                stats['active_users'] = 0
-                stats['total_employees'] = 0
-                stats['active_employees'] = 0
-                stats['active_contracts'] = 0
-                stats['pending_absences'] = 0
-                stats['ongoing_trainings'] = 0
-            
-            # Statistiques Commandes Commerciales (toujours calculées pour l'admin)
-            try:
-                from models import CommercialOrder
-                from utils_region_filter import filter_commercial_orders_by_region
-                from sqlalchemy.exc import SQLAlchemyError
-                
-                # Annuler toute transaction en cours en cas d'erreur précédente
-                db.session.rollback()
-                
-                orders_query = CommercialOrder.query
-                orders_query = filter_commercial_orders_by_region(orders_query)
-                stats['orders_count'] = orders_query.count()
-                stats['orders_pending'] = orders_query.filter_by(status='draft').count()
-                stats['orders_validated'] = orders_query.filter_by(status='validated').count()
-                # Note: l'enum order_status n'a pas "cancelled", mais "rejected" à la place
-                stats['orders_rejected'] = orders_query.filter_by(status='rejected').count()
-                stats['orders_completed'] = orders_query.filter_by(status='completed').count()
-            except (Exception, SQLAlchemyError) as e:
-                print(f"⚠️ Erreur lors du calcul des statistiques commandes: {e}")
-                db.session.rollback()  # Annuler la transaction en cas d'erreur
-                stats['orders_count'] = 0
-                stats['orders_pending'] = 0
-                stats['orders_validated'] = 0
-                stats['orders_rejected'] = 0
-                stats['orders_completed'] = 0
-            
-            # Statistiques Promotion (toujours calculées pour l'admin)
-            try:
-                from models import PromotionTeam, PromotionMember, PromotionSale, PromotionGamme, PromotionReturn
-                from utils_region_filter import filter_teams_by_region, filter_members_by_region, filter_sales_by_region
-                from sqlalchemy.exc import SQLAlchemyError
-                
-                # Annuler toute transaction en cours en cas d'erreur précédente
-                db.session.rollback()
-                
-                # Équipes
-                teams_query = PromotionTeam.query.filter_by(is_active=True)
-                teams_query = filter_teams_by_region(teams_query)
-                stats['promotion_teams'] = teams_query.count()
-                
-                # Membres filtrés par région (utiliser count() directement avec join pour éviter de charger toutes les colonnes)
-                region_id = get_user_region_id()
-                if region_id is not None:
-                    # Compter directement avec join pour éviter de charger toutes les colonnes (home_latitude, home_longitude)
-                    from sqlalchemy import func, and_
-                    members_count = db.session.query(func.count(PromotionMember.id)).join(
-                        PromotionTeam, PromotionMember.team_id == PromotionTeam.id
-                    ).join(
-                        User, PromotionTeam.team_leader_id == User.id
-                    ).filter(
-                        and_(
-                            PromotionMember.is_active == True,
-                            User.region_id == region_id
-                        )
-                    ).scalar()
-                    stats['promotion_members'] = members_count or 0
-                else:
-                    # Admin : compter tous les membres actifs
-                    stats['promotion_members'] = PromotionMember.query.filter_by(is_active=True).count()
-                
-                # Gammes
-                stats['promotion_gammes'] = PromotionGamme.query.filter_by(is_active=True).count()
-                
-                # Ventes (aujourd'hui)
-                today = date.today()
-                sales_query = PromotionSale.query.filter(PromotionSale.sale_date == today)
-                sales_query = filter_sales_by_region(sales_query)
-                stats['promotion_sales_today'] = sales_query.count()
-                
-                # Retours en attente (avec gestion d'erreur spécifique)
-                try:
-                    # Utiliser load_only pour éviter de charger des colonnes qui pourraient ne pas exister
-                    from sqlalchemy.orm import load_only
-                    stats['promotion_returns_pending'] = PromotionReturn.query.options(
-                        load_only(PromotionReturn.id, PromotionReturn.status)
-                    ).filter_by(status='pending').count()
-                except Exception as returns_error:
-                    print(f"⚠️ Erreur lors du calcul des retours en attente: {returns_error}")
-                    db.session.rollback()
-                    stats['promotion_returns_pending'] = 0
-            except (Exception, SQLAlchemyError) as e:
-                print(f"⚠️ Erreur lors du calcul des statistiques promotion: {e}")
-                import traceback
-                traceback.print_exc()
-                db.session.rollback()  # Annuler la transaction en cas d'erreur
-                stats['promotion_teams'] = 0
-                stats['promotion_members'] = 0
-                stats['promotion_gammes'] = 0
-                stats['promotion_sales_today'] = 0
-                stats['promotion_returns_pending'] = 0
-            
-            # Statistiques récentes (7 derniers jours) avec filtrage par région
-            seven_days_ago = datetime.now(UTC) - timedelta(days=7)
-            recent_movements_query = StockMovement.query.filter(StockMovement.movement_date >= seven_days_ago)
-            recent_movements_query = filter_stock_movements_by_region(recent_movements_query)
-            stats['recent_movements'] = recent_movements_query.count()
-            
-            stats['recent_receptions'] = Reception.query.filter(Reception.reception_date >= seven_days_ago).count()
-            # Filtrer les sessions d'inventaire récentes par région
-            recent_sessions_query = InventorySession.query.filter(InventorySession.session_date >= seven_days_ago)
-            recent_sessions_query = filter_inventory_sessions_by_region(recent_sessions_query)
-            stats['recent_sessions'] = recent_sessions_query.count()
-            
-            # Ajouter la région de l'utilisateur pour l'affichage
-            stats['user_region_id'] = user_region_id
-            if user_region_id:
-                user_region = Region.query.get(user_region_id)
-                stats['user_region_name'] = user_region.name if user_region else None
-            else:
-                stats['user_region_name'] = None
-            
-            # Mettre en cache les statistiques (cache 5 minutes)
-            if app.cache:
-                app.cache.set(cache_key, stats, timeout=600)  # 10 minutes pour meilleure performance
+        stats = dashboard_stats.get_dashboard_stats(user_region_id)
         
         # Récupérer les simulations récentes (seulement si l'utilisateur a la permission)
         recent_simulations = []
@@ -1065,9 +865,7 @@ def index():
                     try:
                         from sqlalchemy import text
                         # Vérifier quelles colonnes existent dans la table
-                        from sqlalchemy import inspect
-                        inspector = inspect(db.engine)
-                        columns = [col['name'] for col in inspector.get_columns('simulations')]
+                        columns = schema_registry.get_columns('simulations')
                         
                         # Construire la liste des colonnes à sélectionner (sans target_mode et target_margin_pct)
                         select_cols = []
@@ -1121,17 +919,6 @@ def index():
                                                 value = 'value'
                                             setattr(sim, col, value)
                                     
-                                    # S'assurer que l'ID est défini pour charger les items
-                                    if hasattr(sim, 'id') and sim.id:
-                                        # Charger les items pour calculer la marge
-                                        try:
-                                            from models import SimulationItem
-                                            sim.items = SimulationItem.query.filter_by(simulation_id=sim.id).all()
-                                        except:
-                                            sim.items = []
-                                    else:
-                                        sim.items = []
-                                    
                                     recent_simulations.append(sim)
                                 except Exception as row_error:
                                     print(f"⚠️ Erreur lors du traitement d'une ligne: {row_error}")
@@ -1152,60 +939,8 @@ def index():
                 else:
                     recent_simulations = []
         
-        # Calculer la marge totale pour chaque simulation récente
-        from decimal import Decimal
-        recent_simulations_with_margin = []
-        for sim in recent_simulations:
-            total_margin_gnf = Decimal('0')
-            if sim.items and len(sim.items) > 0:
-                # Calculer le prix de revient total et la valeur de vente totale
-                total_purchase_value = Decimal('0')
-                total_weight = Decimal('0')
-                total_selling_value = Decimal('0')
-                
-                for item in sim.items:
-                    # Prix d'achat en GNF
-                    purchase_price_gnf = Decimal('0')
-                    if item.purchase_currency == 'USD' and sim.rate_usd:
-                        purchase_price_gnf = Decimal(str(item.purchase_price)) * sim.rate_usd
-                    elif item.purchase_currency == 'EUR' and sim.rate_eur:
-                        purchase_price_gnf = Decimal(str(item.purchase_price)) * sim.rate_eur
-                    elif item.purchase_currency == 'XOF' and sim.rate_xof:
-                        purchase_price_gnf = Decimal(str(item.purchase_price)) * sim.rate_xof
-                    
-                    # Valeur totale d'achat
-                    item_value = purchase_price_gnf * Decimal(str(item.quantity))
-                    total_purchase_value += item_value
-                    
-                    # Poids total
-                    item_weight = Decimal(str(item.unit_weight_kg or 0)) * Decimal(str(item.quantity))
-                    total_weight += item_weight
-                    
-                    # Valeur totale de vente
-                    total_selling_value += Decimal(str(item.selling_price_gnf or 0)) * Decimal(str(item.quantity))
-                
-                # Calculer les coûts logistiques totaux
-                total_logistics = Decimal('0')
-                if sim.customs_gnf:
-                    total_logistics += sim.customs_gnf
-                if sim.handling_gnf:
-                    total_logistics += sim.handling_gnf
-                if sim.others_gnf:
-                    total_logistics += sim.others_gnf
-                if sim.transport_fixed_gnf:
-                    total_logistics += sim.transport_fixed_gnf
-                if sim.transport_per_kg_gnf and total_weight > 0:
-                    total_logistics += sim.transport_per_kg_gnf * total_weight
-                
-                # Prix de revient total = prix d'achat + coûts logistiques
-                total_cost = total_purchase_value + total_logistics
-                
-                # Marge totale = valeur de vente - prix de revient
-                total_margin_gnf = total_selling_value - total_cost
-            
-            # Ajouter la marge comme attribut à la simulation
-            sim.total_margin_gnf = total_margin_gnf
-            recent_simulations_with_margin.append(sim)
+        # Articles chargés en une requête, marge totale par le moteur commun landed_cost
+        recent_simulations_with_margin = _attach_simulation_margins(recent_simulations)
         
         # Récupérer les mouvements récents (seulement si l'utilisateur a la permission) avec filtrage par région
         recent_movements = []
@@ -1288,10 +1023,6 @@ def index():
                 traceback.print_exc()
                 recent_promotion_sales = []
         
-        # Mettre en cache les statistiques si elles ont été recalculées (cache 5 minutes)
-        if app.cache and not app.cache.get(cache_key):
-            app.cache.set(cache_key, stats, timeout=300)  # 5 minutes
-        
         return render_template('index_hapag_lloyd.html',
                              counts=stats,
                              recent_simulations=recent_simulations_with_margin,
@@ -1392,10 +1123,9 @@ def simulations_list():
             # Si l'erreur est due à target_mode ou target_margin_pct, utiliser une requête SQL directe
             if 'target_mode' in str(e) or 'target_margin_pct' in str(e):
                 try:
-                    from sqlalchemy import text, inspect
+                    from sqlalchemy import text
                     # Vérifier quelles colonnes existent dans la table
-                    inspector = inspect(db.engine)
-                    columns = [col['name'] for col in inspector.get_columns('simulations')]
+                    columns = schema_registry.get_columns('simulations')
                     
                     # Construire la liste des colonnes à sélectionner (sans target_mode et target_margin_pct)
                     select_cols = []
@@ -1527,79 +1257,12 @@ def simulations_list():
                 simulations = []
                 pagination = None
         
-        # Optimisation N+1 : Charger tous les items en une seule requête
-        simulation_ids = [s.id for s in simulations if hasattr(s, 'id') and s.id]
-        items_map = {}
-        if simulation_ids:
-            try:
-                all_items = SimulationItem.query.filter(SimulationItem.simulation_id.in_(simulation_ids)).all()
-                for item in all_items:
-                    if item.simulation_id not in items_map:
-                        items_map[item.simulation_id] = []
-                    items_map[item.simulation_id].append(item)
-            except Exception as e:
-                print(f"⚠️ Erreur lors du chargement des items: {e}")
-        
-        # Assigner les items aux simulations
-        for sim in simulations:
-            if hasattr(sim, 'id') and sim.id:
-                sim.items = items_map.get(sim.id, [])
-            else:
-                sim.items = []
-        
-        # Calculer la marge totale pour chaque simulation
-        simulations_with_margin = []
-        for sim in simulations:
-            total_margin_gnf = Decimal('0')
-            if sim.items and len(sim.items) > 0:
-                # Calculer le prix de revient total et la valeur de vente totale
-                total_purchase_value = Decimal('0')
-                total_weight = Decimal('0')
-                total_selling_value = Decimal('0')
-                
-                for item in sim.items:
-                    # Prix d'achat en GNF
-                    purchase_price_gnf = Decimal('0')
-                    if item.purchase_currency == 'USD' and sim.rate_usd:
-                        purchase_price_gnf = Decimal(str(item.purchase_price)) * sim.rate_usd
-                    elif item.purchase_currency == 'EUR' and sim.rate_eur:
-                        purchase_price_gnf = Decimal(str(item.purchase_price)) * sim.rate_eur
-                    elif item.purchase_currency == 'XOF' and sim.rate_xof:
-                        purchase_price_gnf = Decimal(str(item.purchase_price)) * sim.rate_xof
-                    
-                    # Valeur totale d'achat
-                    item_value = purchase_price_gnf * Decimal(str(item.quantity))
-                    total_purchase_value += item_value
-                    
-                    # Poids total
-                    item_weight = Decimal(str(item.unit_weight_kg or 0)) * Decimal(str(item.quantity))
-                    total_weight += item_weight
-                    
-                    # Valeur totale de vente
-                    total_selling_value += Decimal(str(item.selling_price_gnf or 0)) * Decimal(str(item.quantity))
-                
-                # Calculer les coûts logistiques totaux
-                total_logistics = Decimal('0')
-                if sim.customs_gnf:
-                    total_logistics += sim.customs_gnf
-                if sim.handling_gnf:
-                    total_logistics += sim.handling_gnf
-                if sim.others_gnf:
-                    total_logistics += sim.others_gnf
-                if sim.transport_fixed_gnf:
-                    total_logistics += sim.transport_fixed_gnf
-                if sim.transport_per_kg_gnf and total_weight > 0:
-                    total_logistics += sim.transport_per_kg_gnf * total_weight
-                
-                # Prix de revient total = prix d'achat + coûts logistiques
-                total_cost = total_purchase_value + total_logistics
-                
-                # Marge totale = valeur de vente - prix de revient
-                total_margin_gnf = total_selling_value - total_cost
-            
-            # Ajouter la marge comme attribut à la simulation
-            sim.total_margin_gnf = total_margin_gnf
-            simulations_with_margin.append(sim)
+        # Articles chargés en une seule requête (pas de N+1), marge totale par le moteur commun landed_cost
+        try:
+            simulations_with_margin = _attach_simulation_margins(simulations)
+        except Exception as e:
+            print(f"⚠️ Erreur lors du chargement des items: {e}")
+            simulations_with_margin = simulations
         
         # Calculer la marge moyenne
         total_margin = 0
@@ -1630,7 +1293,7 @@ def simulations_list():
 def simulation_preview(id):
     """Prévisualisation avant export PDF/Excel"""
     from models import Simulation, SimulationItem
-    from sqlalchemy import text, inspect
+    from sqlalchemy import text
     from decimal import Decimal
     
     try:
@@ -1638,8 +1301,7 @@ def simulation_preview(id):
     except Exception as e:
         if 'target_mode' in str(e) or 'target_margin_pct' in str(e):
             try:
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('simulations')]
+                columns = schema_registry.get_columns('simulations')
                 select_cols = []
                 for col in ['id', 'rate_usd', 'rate_eur', 'rate_xof', 'customs_gnf', 'handling_gnf', 
                            'others_gnf', 'transport_fixed_gnf', 'transport_per_kg_gnf', 'basis',
@@ -1684,94 +1346,17 @@ def simulation_preview(id):
     
     items = SimulationItem.query.filter_by(simulation_id=id).all()
     
-    # Calculer les totaux (identique à simulation_detail)
-    total_purchase_value = Decimal('0')
-    total_weight = Decimal('0')
-    total_selling_value = Decimal('0')
-    
-    # Calculer le prix de revient pour chaque article (avec coûts logistiques)
-    items_with_cost = []
-    for item in items:
-        # Convertir le prix d'achat en GNF selon la devise
-        rate = simulation.rate_usd
-        if item.purchase_currency == 'EUR':
-            rate = simulation.rate_eur
-        elif item.purchase_currency == 'XOF':
-            rate = simulation.rate_xof if simulation.rate_xof else simulation.rate_usd
-        
-        purchase_price_gnf = Decimal(str(item.purchase_price)) * Decimal(str(rate))
-        item_value = purchase_price_gnf * Decimal(str(item.quantity))
-        item_weight = Decimal(str(item.quantity)) * Decimal(str(item.unit_weight_kg))
-        
-        total_purchase_value += item_value
-        total_weight += item_weight
-        total_selling_value += Decimal(str(item.selling_price_gnf)) * Decimal(str(item.quantity))
-    
-    # Calculer les coûts logistiques totaux
-    total_fixed_costs = (
-        Decimal(str(simulation.customs_gnf)) +
-        Decimal(str(simulation.handling_gnf)) +
-        Decimal(str(simulation.others_gnf)) +
-        Decimal(str(simulation.transport_fixed_gnf))
-    )
-    
-    total_variable_costs = Decimal(str(simulation.transport_per_kg_gnf)) * total_weight
-    
-    total_logistics = total_fixed_costs + total_variable_costs
-    
-    # Prix de revient total = prix d'achat + coûts logistiques
-    total_cost = total_purchase_value + total_logistics
-    
-    # Marge totale = valeur de vente - prix de revient
-    total_margin = total_selling_value - total_cost
-    
-    # Calculer le prix de revient pour chaque article
-    for item in items:
-        # Convertir le prix d'achat en GNF
-        rate = simulation.rate_usd
-        if item.purchase_currency == 'EUR':
-            rate = simulation.rate_eur
-        elif item.purchase_currency == 'XOF':
-            rate = simulation.rate_xof if simulation.rate_xof else simulation.rate_usd
-        
-        purchase_price_gnf = Decimal(str(item.purchase_price)) * Decimal(str(rate))
-        item_value = purchase_price_gnf * Decimal(str(item.quantity))
-        item_weight = Decimal(str(item.quantity)) * Decimal(str(item.unit_weight_kg))
-        
-        # Répartir les coûts logistiques selon la base
-        if simulation.basis == 'weight' and total_weight > 0:
-            logistics_cost = (total_logistics * item_weight) / total_weight
-        else:  # 'value' ou autre
-            logistics_cost = (total_logistics * item_value) / total_purchase_value if total_purchase_value > 0 else Decimal('0')
-        
-        # Prix de revient par unité
-        logistics_per_unit = logistics_cost / Decimal(str(item.quantity)) if item.quantity > 0 else Decimal('0')
-        cost_price_per_unit = purchase_price_gnf + logistics_per_unit
-        
-        # Marge
-        selling_price = Decimal(str(item.selling_price_gnf))
-        margin = selling_price - cost_price_per_unit
-        margin_pct = (margin / cost_price_per_unit * 100) if cost_price_per_unit > 0 else Decimal('0')
-        
-        items_with_cost.append({
-            'item': item,
-            'purchase_price_gnf': purchase_price_gnf,
-            'logistics_per_unit': logistics_per_unit,
-            'cost_price_per_unit': cost_price_per_unit,
-            'total_cost': cost_price_per_unit * Decimal(str(item.quantity)),
-            'selling_price': selling_price,
-            'margin': margin,
-            'margin_pct': margin_pct
-        })
+    # Prix de revient par article et totaux (moteur commun landed_cost)
+    costs = landed_cost.landed_costs(simulation, items)
     
     return render_template('simulation_preview.html', 
                          simulation=simulation, 
-                         items=items_with_cost,
-                         total_purchase_value=total_purchase_value,
-                         total_selling_value=total_selling_value,
-                         total_logistics=total_logistics,
-                         total_cost=total_cost,
-                         total_margin=total_margin)
+                         items=costs.lines,
+                         total_purchase_value=costs.total_purchase_value,
+                         total_selling_value=costs.total_selling_value,
+                         total_logistics=costs.total_logistics,
+                         total_cost=costs.total_cost,
+                         total_margin=costs.total_margin)
 
 @app.route('/simulations/<int:id>/pdf')
 @login_required
@@ -1780,7 +1365,7 @@ def simulation_pdf(id):
     from models import Simulation, SimulationItem
     from pdf_generator import PDFGenerator
     from flask import send_file, make_response, request
-    from sqlalchemy import text, inspect
+    from sqlalchemy import text
     
     # Récupérer la devise sélectionnée (par défaut GNF)
     currency = request.args.get('currency', 'GNF').upper()
@@ -1793,8 +1378,7 @@ def simulation_pdf(id):
             simulation = Simulation.query.get_or_404(id)
         except Exception as e:
             if 'target_mode' in str(e) or 'target_margin_pct' in str(e):
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('simulations')]
+                columns = schema_registry.get_columns('simulations')
                 select_cols = []
                 for col in ['id', 'rate_usd', 'rate_eur', 'rate_xof', 'customs_gnf', 'handling_gnf', 
                            'others_gnf', 'transport_fixed_gnf', 'transport_per_kg_gnf', 'basis',
@@ -1868,7 +1452,7 @@ def simulation_excel(id):
     from flask import send_file, make_response, request
     import pandas as pd
     from io import BytesIO
-    from sqlalchemy import text, inspect
+    from sqlalchemy import text
     
     # Récupérer la devise sélectionnée (par défaut GNF)
     currency = request.args.get('currency', 'GNF').upper()
@@ -1881,8 +1465,7 @@ def simulation_excel(id):
             simulation = Simulation.query.get_or_404(id)
         except Exception as e:
             if 'target_mode' in str(e) or 'target_margin_pct' in str(e):
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('simulations')]
+                columns = schema_registry.get_columns('simulations')
                 select_cols = []
                 for col in ['id', 'rate_usd', 'rate_eur', 'rate_xof', 'customs_gnf', 'handling_gnf', 
                            'others_gnf', 'transport_fixed_gnf', 'transport_per_kg_gnf', 'basis',
@@ -1928,98 +1511,36 @@ def simulation_excel(id):
             flash('Aucun article dans cette simulation', 'warning')
             return redirect(url_for('simulation_preview', id=id))
         
-        # Calculer les totaux et prix de revient (comme dans preview)
-        total_purchase_value = Decimal('0')
-        total_weight = Decimal('0')
-        total_selling_value = Decimal('0')
+        # Prix de revient par article (moteur commun landed_cost), montants convertis dans la devise choisie
+        costs = landed_cost.landed_costs(simulation, items)
+        exchange_rate = landed_cost.conversion_rate(simulation, currency)
         
-        for item in items:
-            rate = simulation.rate_usd
-            if item.purchase_currency == 'EUR':
-                rate = simulation.rate_eur
-            elif item.purchase_currency == 'XOF':
-                rate = simulation.rate_xof if simulation.rate_xof else simulation.rate_usd
-            
-            purchase_price_gnf = Decimal(str(item.purchase_price)) * Decimal(str(rate))
-            item_value = purchase_price_gnf * Decimal(str(item.quantity))
-            item_weight = Decimal(str(item.quantity)) * Decimal(str(item.unit_weight_kg))
-            
-            total_purchase_value += item_value
-            total_weight += item_weight
-            total_selling_value += Decimal(str(item.selling_price_gnf)) * Decimal(str(item.quantity))
-        
-        # Calculer les coûts logistiques
-        total_fixed_costs = (
-            Decimal(str(simulation.customs_gnf)) +
-            Decimal(str(simulation.handling_gnf)) +
-            Decimal(str(simulation.others_gnf)) +
-            Decimal(str(simulation.transport_fixed_gnf))
-        )
-        total_variable_costs = Decimal(str(simulation.transport_per_kg_gnf)) * total_weight
-        total_logistics = total_fixed_costs + total_variable_costs
-        total_cost = total_purchase_value + total_logistics
-        
-        # Déterminer le taux de change pour la conversion
-        exchange_rate = None
-        if currency == 'USD':
-            exchange_rate = float(simulation.rate_usd) if simulation.rate_usd else None
-        elif currency == 'EUR':
-            exchange_rate = float(simulation.rate_eur) if simulation.rate_eur else None
-        elif currency == 'XOF':
-            exchange_rate = float(simulation.rate_xof) if simulation.rate_xof else None
-        
-        def convert_amount(amount_gnf, rate):
+        def convert_amount(amount_gnf):
             """Convertit un montant GNF vers la devise cible"""
-            if currency == 'GNF' or not rate or rate == 0:
-                return amount_gnf
-            return amount_gnf / rate
+            amount_gnf = float(amount_gnf)
+            return amount_gnf / exchange_rate if exchange_rate else amount_gnf
         
         # Préparer les données pour Excel
         data = []
-        for item in items:
+        for line in costs.lines:
+            item = line['item']
             article_name = getattr(item, 'article_name', 'N/A')
             if hasattr(item, 'article') and item.article:
                 article_name = item.article.name or article_name
             
-            rate = simulation.rate_usd
-            if item.purchase_currency == 'EUR':
-                rate = simulation.rate_eur
-            elif item.purchase_currency == 'XOF':
-                rate = simulation.rate_xof if simulation.rate_xof else simulation.rate_usd
-            
-            purchase_price_gnf = float(item.purchase_price) * float(rate)
-            item_value = purchase_price_gnf * float(item.quantity)
-            item_weight = float(item.quantity) * float(item.unit_weight_kg)
-            
-            # Répartir les coûts logistiques
-            if simulation.basis == 'weight' and total_weight > 0:
-                logistics_cost = (float(total_logistics) * item_weight) / float(total_weight)
-            else:
-                logistics_cost = (float(total_logistics) * item_value) / float(total_purchase_value) if total_purchase_value > 0 else 0
-            
-            logistics_per_unit = logistics_cost / float(item.quantity) if item.quantity > 0 else 0
-            cost_price_per_unit = purchase_price_gnf + logistics_per_unit
-            
-            selling_price_gnf = float(item.selling_price_gnf)
-            quantity = float(item.quantity)
-            total_purchase = purchase_price_gnf * quantity
-            total_cost_item = cost_price_per_unit * quantity
-            total_selling = selling_price_gnf * quantity
-            margin = total_selling - total_cost_item
-            
             data.append({
                 'Article': article_name,
-                'Quantité': quantity,
-                'Prix Achat (GNF)': purchase_price_gnf,
-                'Coûts Log. (GNF)': logistics_per_unit,
-                'Prix de Revient (GNF)': cost_price_per_unit,
-                'Prix Vente (GNF)': selling_price_gnf,
-                'Total Achat (GNF)': total_purchase,
-                'Total Coûts Log. (GNF)': logistics_cost,
-                'Total Prix Revient (GNF)': total_cost_item,
-                'Total Vente (GNF)': total_selling,
-                'Marge (GNF)': margin,
-                'Marge (%)': (margin / total_cost_item * 100) if total_cost_item > 0 else 0
+                'Quantité': float(line['quantity']),
+                f'Prix Achat ({currency})': convert_amount(line['purchase_price_gnf']),
+                f'Coûts Log. ({currency})': convert_amount(line['logistics_per_unit']),
+                f'Prix de Revient ({currency})': convert_amount(line['cost_price_per_unit']),
+                f'Prix Vente ({currency})': convert_amount(line['selling_price']),
+                f'Total Achat ({currency})': convert_amount(line['item_value']),
+                f'Total Coûts Log. ({currency})': convert_amount(line['logistics_cost']),
+                f'Total Prix Revient ({currency})': convert_amount(line['total_cost']),
+                f'Total Vente ({currency})': convert_amount(line['total_selling']),
+                f'Marge ({currency})': convert_amount(line['total_selling'] - line['total_cost']),
+                'Marge (%)': float(line['margin_pct'])
             })
         
         # Créer le DataFrame
@@ -2068,7 +1589,7 @@ def simulation_excel(id):
 def simulation_detail(id):
     """Détails d'une simulation"""
     from models import Simulation, SimulationItem
-    from sqlalchemy import text, inspect
+    from sqlalchemy import text
     from decimal import Decimal
     
     try:
@@ -2078,8 +1599,7 @@ def simulation_detail(id):
         # Si erreur due à target_mode, utiliser SQL direct
         if 'target_mode' in str(e) or 'target_margin_pct' in str(e):
             try:
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('simulations')]
+                columns = schema_registry.get_columns('simulations')
                 
                 # Construire la liste des colonnes à sélectionner
                 select_cols = []
@@ -2132,92 +1652,22 @@ def simulation_detail(id):
     
     items = SimulationItem.query.filter_by(simulation_id=id).all()
     
-    # Calculer le prix de revient pour chaque article
-    from decimal import Decimal
-    
-    # Calculer les totaux
-    total_purchase_value = Decimal('0')
-    total_weight = Decimal('0')
-    
-    for item in items:
-        # Convertir le prix d'achat en GNF selon la devise
-        rate = simulation.rate_usd
-        if item.purchase_currency == 'EUR':
-            rate = simulation.rate_eur
-        elif item.purchase_currency == 'XOF':
-            rate = simulation.rate_xof if simulation.rate_xof else simulation.rate_usd
-        
-        purchase_price_gnf = Decimal(str(item.purchase_price)) * Decimal(str(rate))
-        item_value = purchase_price_gnf * Decimal(str(item.quantity))
-        item_weight = Decimal(str(item.quantity)) * Decimal(str(item.unit_weight_kg))
-        
-        total_purchase_value += item_value
-        total_weight += item_weight
-    
-    # Calculer les coûts logistiques totaux
-    total_fixed_costs = (
-        Decimal(str(simulation.customs_gnf)) +
-        Decimal(str(simulation.handling_gnf)) +
-        Decimal(str(simulation.others_gnf)) +
-        Decimal(str(simulation.transport_fixed_gnf))
-    )
-    total_variable_costs = total_weight * Decimal(str(simulation.transport_per_kg_gnf))
-    total_logistics_costs = total_fixed_costs + total_variable_costs
-    
-    # Calculer le prix de revient pour chaque article
-    items_with_cost = []
-    for item in items:
-        # Convertir le prix d'achat en GNF
-        rate = simulation.rate_usd
-        if item.purchase_currency == 'EUR':
-            rate = simulation.rate_eur
-        elif item.purchase_currency == 'XOF':
-            rate = simulation.rate_xof if simulation.rate_xof else simulation.rate_usd
-        
-        purchase_price_gnf = Decimal(str(item.purchase_price)) * Decimal(str(rate))
-        item_value = purchase_price_gnf * Decimal(str(item.quantity))
-        item_weight = Decimal(str(item.quantity)) * Decimal(str(item.unit_weight_kg))
-        
-        # Répartir les coûts logistiques selon la base
-        logistics_cost = Decimal('0')
-        if simulation.basis == 'value' and total_purchase_value > 0:
-            logistics_cost = (item_value / total_purchase_value) * total_logistics_costs
-        elif simulation.basis == 'weight' and total_weight > 0:
-            logistics_cost = (item_weight / total_weight) * total_logistics_costs
-        
-        # Prix de revient par unité
-        logistics_per_unit = logistics_cost / Decimal(str(item.quantity)) if item.quantity > 0 else Decimal('0')
-        cost_price_per_unit = purchase_price_gnf + logistics_per_unit
-        
-        # Marge
-        selling_price = Decimal(str(item.selling_price_gnf))
-        margin = selling_price - cost_price_per_unit
-        margin_pct = (margin / cost_price_per_unit * 100) if cost_price_per_unit > 0 else Decimal('0')
-        
-        items_with_cost.append({
-            'item': item,
-            'purchase_price_gnf': purchase_price_gnf,
-            'logistics_per_unit': logistics_per_unit,
-            'cost_price_per_unit': cost_price_per_unit,
-            'total_cost': cost_price_per_unit * Decimal(str(item.quantity)),
-            'selling_price': selling_price,
-            'margin': margin,
-            'margin_pct': margin_pct
-        })
+    # Prix de revient par article (moteur commun landed_cost)
+    costs = landed_cost.landed_costs(simulation, items)
     
     return render_template('simulation_detail.html', 
                          simulation=simulation, 
                          items=items,
-                         items_with_cost=items_with_cost,
-                         total_logistics_costs=total_logistics_costs,
-                         total_purchase_value=total_purchase_value)
+                         items_with_cost=costs.lines,
+                         total_logistics_costs=costs.total_logistics,
+                         total_purchase_value=costs.total_purchase_value)
 
 @app.route('/simulations/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def simulation_edit(id):
     """Modifier une simulation"""
     from models import Simulation, SimulationItem, Article, Category
-    from sqlalchemy import text, inspect
+    from sqlalchemy import text
     from decimal import Decimal
     
     try:
@@ -2227,8 +1677,7 @@ def simulation_edit(id):
         # Si erreur due à target_mode, utiliser SQL direct
         if 'target_mode' in str(e) or 'target_margin_pct' in str(e):
             try:
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('simulations')]
+                columns = schema_registry.get_columns('simulations')
                 
                 # Construire la liste des colonnes à sélectionner
                 select_cols = []
@@ -2297,9 +1746,8 @@ def simulation_edit(id):
             
             # Utiliser une mise à jour SQL directe pour éviter les problèmes de colonnes manquantes
             try:
-                from sqlalchemy import text, inspect
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('simulations')]
+                from sqlalchemy import text
+                columns = schema_registry.get_columns('simulations')
                 
                 # Construire la requête UPDATE avec seulement les colonnes qui existent
                 update_fields = []
@@ -2476,9 +1924,7 @@ def simulation_new():
             
             # Vérifier quelles colonnes existent dans la table
             try:
-                from sqlalchemy import inspect
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('simulations')]
+                columns = schema_registry.get_columns('simulations')
                 print(f"📋 Colonnes disponibles dans simulations: {columns}")
                 
                 # Ne garder que les colonnes qui existent dans la table
@@ -3548,11 +2994,10 @@ def article_edit(id):
 def check_simulations():
     """Vérifier les simulations dans la base de données"""
     try:
-        from sqlalchemy import text, inspect
+        from sqlalchemy import text
         
         # Vérifier les colonnes de la table
-        inspector = inspect(db.engine)
-        columns = [col['name'] for col in inspector.get_columns('simulations')]
+        columns = schema_registry.get_columns('simulations')
         
         # Compter les simulations
         result = db.session.execute(text("SELECT COUNT(*) as count FROM simulations"))
@@ -3687,53 +3132,32 @@ def api_articles():
 
 # Routes Forecast & Ventes
 from models import Forecast, ForecastItem, StockItem, StockOutgoing, StockOutgoingDetail
+import realized_sales
 from datetime import datetime, date, UTC, timedelta
 from sqlalchemy import func, and_, or_
 
 def calculate_realized_sales(stock_item_id, start_date, end_date):
-    """Calculer les ventes réalisées pour un article sur une période"""
-    # Récupérer toutes les sorties de stock (ventes) dans la période
-    outgoings = StockOutgoing.query.filter(
-        and_(
-            StockOutgoing.outgoing_date >= start_date,
-            StockOutgoing.outgoing_date <= end_date,
-            StockOutgoing.status == 'completed'
-        )
-    ).all()
-    
-    total_quantity = Decimal('0')
-    total_value = Decimal('0')
-    count = 0
-    
-    for outgoing in outgoings:
-        # Récupérer les détails pour cet article
-        details = StockOutgoingDetail.query.filter_by(
-            outgoing_id=outgoing.id,
-            stock_item_id=stock_item_id
-        ).all()
-        
-        for detail in details:
-            total_quantity += Decimal(str(detail.quantity))
-            if detail.unit_price_gnf:
-                total_value += Decimal(str(detail.quantity)) * Decimal(str(detail.unit_price_gnf))
-            count += 1
-    
-    # Calculer la moyenne réalisée
-    avg_quantity = total_quantity / count if count > 0 else Decimal('0')
-    
-    return {
-        'total_quantity': float(total_quantity),
-        'avg_quantity': float(avg_quantity),
-        'total_value': float(total_value),
-        'count': count
-    }
+    """Calculer les ventes réalisées pour un article sur une période (voir realized_sales pour le calcul en masse)"""
+    return realized_sales.realized_sales([(stock_item_id, start_date, end_date)])[(stock_item_id, start_date, end_date)]
+
+def _apply_realized_values(forecasts):
+    """Met à jour total_realized_value (GNF) des prévisions affichées depuis les ventes réalisées"""
+    try:
+        totals = realized_sales.realized_value_by_forecast([f.id for f in forecasts if f.id])
+    except Exception as e:
+        print(f"⚠️ Erreur lors du calcul des ventes réalisées: {e}")
+        db.session.rollback()
+        return
+    for f in forecasts:
+        if f.id in totals:
+            f.total_realized_value = totals[f.id]
 
 @app.route('/forecast')
 @login_required
 def forecast_dashboard():
     """Dashboard des prévisions"""
     from models import Forecast
-    from sqlalchemy import inspect, text
+    from sqlalchemy import text
     from auth import is_admin_or_supervisor
     
     try:
@@ -3773,8 +3197,7 @@ def forecast_dashboard():
         # Si erreur due à des colonnes manquantes, utiliser SQL direct
         if 'currency' in str(e) or 'rate_usd' in str(e) or 'rate_eur' in str(e) or 'rate_xof' in str(e):
             try:
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('forecasts')]
+                columns = schema_registry.get_columns('forecasts')
                 
                 # Construire la requête avec seulement les colonnes existantes
                 select_cols = ['id', 'name', 'status', 'total_forecast_value', 'total_realized_value']
@@ -3846,7 +3269,7 @@ def forecast_new():
         return redirect(url_for('forecast_dashboard'))
     
     from models import StockItem, Simulation
-    from sqlalchemy import inspect, text
+    from sqlalchemy import text
     
     if request.method == 'POST':
         try:
@@ -3868,8 +3291,7 @@ def forecast_new():
                 # Si erreur due à des colonnes manquantes, utiliser SQL direct
                 if 'target_mode' in str(e) or 'target_margin_pct' in str(e):
                     try:
-                        inspector = inspect(db.engine)
-                        columns = [col['name'] for col in inspector.get_columns('simulations')]
+                        columns = schema_registry.get_columns('simulations')
                         
                         select_cols = ['id', 'rate_usd', 'rate_eur', 'rate_xof', 'created_at']
                         cols_str = ', '.join(select_cols)
@@ -3915,8 +3337,7 @@ def forecast_new():
                 # Si erreur due à des colonnes manquantes, utiliser SQL direct
                 if 'currency' in str(e) or 'rate_usd' in str(e) or 'commercial_name' in str(e):
                     try:
-                        inspector = inspect(db.engine)
-                        columns = [col['name'] for col in inspector.get_columns('forecasts')]
+                        columns = schema_registry.get_columns('forecasts')
                         
                         # Construire l'INSERT avec seulement les colonnes existantes
                         insert_cols = ['name', 'description', 'start_date', 'end_date', 'status', 
@@ -4050,8 +3471,7 @@ def forecast_new():
                 # Si erreur, utiliser SQL direct pour mettre à jour
                 if 'currency' in str(e) or 'rate_usd' in str(e):
                     try:
-                        inspector = inspect(db.engine)
-                        columns = [col['name'] for col in inspector.get_columns('forecasts')]
+                        columns = schema_registry.get_columns('forecasts')
                         
                         update_fields = ['total_forecast_value = :total_forecast_value']
                         update_params = {
@@ -4282,7 +3702,7 @@ def forecast_detail(id):
             f.write(json.dumps({"id":"log_entry","timestamp":int(time.time()*1000),"location":"app.py:3165","message":"forecast_detail entry","data":{"forecast_id":id,"user_id":current_user.id if current_user else None,"user_role":current_user.role.code if (current_user and current_user.role) else None},"sessionId":"debug-session","runId":"test-permissions","hypothesisId":"C"}) + "\n")
     except: pass
     # #endregion
-    from sqlalchemy import inspect, text
+    from sqlalchemy import text
     from auth import is_admin_or_supervisor
     
     try:
@@ -4312,8 +3732,7 @@ def forecast_detail(id):
         # Si erreur due à des colonnes manquantes, utiliser SQL direct
         if 'currency' in str(e) or 'rate_usd' in str(e):
             try:
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('forecasts')]
+                columns = schema_registry.get_columns('forecasts')
                 
                 select_cols = ['id', 'name', 'description', 'start_date', 'end_date', 'status', 
                               'total_forecast_value', 'total_realized_value', 'created_by_id']
@@ -4379,13 +3798,12 @@ def forecast_detail(id):
     items_with_realizations = []
     total_realized_value_gnf = Decimal('0')
     
+    # Ventes réalisées et stock disponible de tous les articles en requêtes groupées
+    realizations = realized_sales.realized_sales_for_forecasts([forecast.id]) if forecast.id else {}
+    available_by_item = realized_sales.stock_available_by_item({item.stock_item_id for item in forecast.items})
+    
     for item in forecast.items:
-        # Calculer les ventes réalisées
-        realized = calculate_realized_sales(
-            item.stock_item_id,
-            forecast.start_date,
-            forecast.end_date
-        )
+        realized = realizations.get(item.id) or realized_sales.empty_stats()
         
         # Mettre à jour les réalisations (toujours en GNF dans la DB)
         item.realized_quantity = Decimal(str(realized['avg_quantity']))
@@ -4419,11 +3837,8 @@ def forecast_detail(id):
         target_50_gnf = forecast_value_gnf * Decimal('0.5')
         item.deviation_50pct_currency = convert_to_currency(item.realized_value_gnf - target_50_gnf, currency)
         
-        # QAF (Quantité disponible) - récupérer depuis le stock
-        from models import DepotStock, VehicleStock
-        depot_stock = sum(float(ds.quantity) for ds in DepotStock.query.filter_by(stock_item_id=item.stock_item_id).all())
-        vehicle_stock = sum(float(vs.quantity) for vs in VehicleStock.query.filter_by(stock_item_id=item.stock_item_id).all())
-        item.quantity_available = Decimal(str(depot_stock + vehicle_stock))
+        # QAF (Quantité disponible) - stock dépôts + véhicules
+        item.quantity_available = available_by_item.get(item.stock_item_id, Decimal('0'))
         
         # Nb Jr (nombre de jours dans la période)
         days = (forecast.end_date - forecast.start_date).days + 1
@@ -4465,7 +3880,7 @@ def forecast_enter_realizations(id):
             return redirect(url_for('forecast_list'))
     
     from models import ForecastItem
-    from sqlalchemy import inspect, text
+    from sqlalchemy import text
     
     if request.method == 'POST':
         try:
@@ -4480,8 +3895,7 @@ def forecast_enter_realizations(id):
             rate_xof = Decimal('0')
             
             try:
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('forecasts')]
+                columns = schema_registry.get_columns('forecasts')
                 if 'rate_usd' in columns and forecast.rate_usd:
                     rate_usd = Decimal(str(forecast.rate_usd))
                 if 'rate_eur' in columns and forecast.rate_eur:
@@ -4528,8 +3942,7 @@ def forecast_enter_realizations(id):
     rate_xof = Decimal('0')
     
     try:
-        inspector = inspect(db.engine)
-        columns = [col['name'] for col in inspector.get_columns('forecasts')]
+        columns = schema_registry.get_columns('forecasts')
         if 'rate_usd' in columns and forecast.rate_usd:
             rate_usd = Decimal(str(forecast.rate_usd))
         if 'rate_eur' in columns and forecast.rate_eur:
@@ -4632,7 +4045,7 @@ def forecast_edit(id):
     if request.method == 'POST':
         try:
             from models import ForecastItem
-            from sqlalchemy import inspect, text
+            from sqlalchemy import text
             
             forecast.name = request.form.get('name')
             forecast.description = request.form.get('description')
@@ -4643,8 +4056,7 @@ def forecast_edit(id):
             # Mettre à jour la devise si elle existe
             currency = request.form.get('currency', 'GNF')
             try:
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('forecasts')]
+                columns = schema_registry.get_columns('forecasts')
                 if 'currency' in columns:
                     forecast.currency = currency
             except:
@@ -4666,8 +4078,7 @@ def forecast_edit(id):
             rate_xof = Decimal('0')
             
             try:
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('forecasts')]
+                columns = schema_registry.get_columns('forecasts')
                 if 'rate_usd' in columns and forecast.rate_usd:
                     rate_usd = Decimal(str(forecast.rate_usd))
                 if 'rate_eur' in columns and forecast.rate_eur:
@@ -4760,7 +4171,7 @@ def forecast_delete(id):
 def forecast_performance():
     """Performance des prévisions avec données pour graphiques"""
     from models import Forecast
-    from sqlalchemy import inspect, text
+    from sqlalchemy import text
     from collections import defaultdict
     
     # Récupérer toutes les prévisions actives ou terminées
@@ -4771,8 +4182,7 @@ def forecast_performance():
     except:
         # Fallback SQL si colonnes manquantes
         try:
-            inspector = inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('forecasts')]
+            columns = schema_registry.get_columns('forecasts')
             select_cols = ['id', 'name', 'start_date', 'end_date', 'status', 
                           'total_forecast_value', 'total_realized_value', 'created_at']
             if 'commercial_name' in columns:
@@ -4808,6 +4218,9 @@ def forecast_performance():
             print(f"⚠️ Erreur lors de la récupération des prévisions: {e}")
             forecasts = []
     
+    # Valeurs réalisées à jour (sorties terminées) de toutes les prévisions en une requête groupée
+    _apply_realized_values(forecasts)
+    
     # Calculer les métriques globales
     total_forecast_value = sum(float(f.total_forecast_value) for f in forecasts)
     total_realized_value = sum(float(f.total_realized_value) for f in forecasts)
@@ -4874,7 +4287,7 @@ def forecast_quick_entry():
         return redirect(url_for('forecast_dashboard'))
     
     from models import StockItem, ForecastItem
-    from sqlalchemy import inspect, text
+    from sqlalchemy import text
     
     if request.method == 'POST':
         try:
@@ -4921,8 +4334,7 @@ def forecast_quick_entry():
             except Exception as e:
                 if 'commercial_name' in str(e):
                     # Utiliser SQL direct si la colonne n'existe pas
-                    inspector = inspect(db.engine)
-                    columns = [col['name'] for col in inspector.get_columns('forecasts')]
+                    columns = schema_registry.get_columns('forecasts')
                     
                     insert_cols = ['name', 'description', 'start_date', 'end_date', 'status', 
                                  'total_forecast_value', 'total_realized_value', 'created_by_id', 'created_at']
@@ -5153,8 +4565,7 @@ def forecast_import():
             except Exception as e:
                 if 'commercial_name' in str(e):
                     # Utiliser SQL direct
-                    inspector = inspect(db.engine)
-                    columns = [col['name'] for col in inspector.get_columns('forecasts')]
+                    columns = schema_registry.get_columns('forecasts')
                     
                     insert_cols = ['name', 'description', 'start_date', 'end_date', 'status', 
                                  'total_forecast_value', 'total_realized_value', 'created_by_id', 'created_at']
@@ -5303,7 +4714,7 @@ def forecast_import():
 def forecast_summary():
     """Vue récapitulative centralisée par commercial"""
     from sqlalchemy import func
-    from sqlalchemy import inspect, text
+    from sqlalchemy import text
     
     # Récupérer toutes les prévisions groupées par commercial
     try:
@@ -5311,8 +4722,7 @@ def forecast_summary():
     except:
         # Si la colonne commercial_name n'existe pas, utiliser SQL direct
         try:
-            inspector = inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('forecasts')]
+            columns = schema_registry.get_columns('forecasts')
             
             select_cols = ['id', 'name', 'start_date', 'end_date', 'status', 
                           'total_forecast_value', 'total_realized_value', 'created_at']
@@ -5348,6 +4758,9 @@ def forecast_summary():
             print(f"⚠️ Erreur lors de la récupération: {e}")
             forecasts = []
     
+    # Valeurs réalisées à jour (sorties terminées) de toutes les prévisions en une requête groupée
+    _apply_realized_values(forecasts)
+    
     # Grouper par commercial
     by_commercial = {}
     for forecast in forecasts:
@@ -5371,6 +4784,32 @@ def api_test():
     """Route de test"""
     return jsonify({"message": "API fonctionne", "status": "ok"})
 
+@app.route('/api/admin/db-adapter/stats')
+@login_required
+def api_db_adapter_stats():
+    """Compteurs du traducteur de requêtes MySQL → PostgreSQL (cache, temps de traduction)"""
+    from auth import is_admin
+    if not is_admin(current_user):
+        return jsonify({'error': 'Accès réservé aux administrateurs'}), 403
+    from db_utils.db_adapter import get_translation_stats
+    stats = get_translation_stats()
+    stats['dialect'] = db.engine.dialect.name
+    return jsonify(stats)
+
+@app.route('/api/admin/schema-registry', methods=['GET', 'POST'])
+@login_required
+def api_schema_registry():
+    """Registre du schéma : état (GET) ou rechargement sur tout le cluster après une migration (POST)"""
+    from auth import is_admin
+    if not is_admin(current_user):
+        return jsonify({'error': 'Accès réservé aux administrateurs'}), 403
+    if request.method == 'POST':
+        try:
+            return jsonify({'success': True, **schema_registry.refresh_cluster()})
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify(schema_registry.get_info())
+
 # Gestion des erreurs
 @app.errorhandler(404)
 def not_found(error):
@@ -5421,6 +4860,7 @@ def init_database():
     try:
         # Créer toutes les tables
         db.create_all()
+        schema_registry.refresh_cluster()
         
         # Créer le rôle admin
         admin_role = Role.query.filter_by(code='admin').first()
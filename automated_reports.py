@@ -397,7 +397,11 @@ def test_report(report_id):
         
         return jsonify({
             'success': True,
-            'message': 'Rapport test envoyé avec succès!'
+            'message': 'Rapport test envoyé avec succès!',
+            'sent': report.last_sent_count,
+            'failed': report.last_failed_count,
+            'duration_ms': report.last_duration_ms,
+            'error': report.last_error
         })
     except Exception as e:
         logger.error(f"Erreur lors du test du rapport: {e}")
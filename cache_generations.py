@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache à génération et suivi des modifications ORM
+
+Utilisé par les caches dérivés de la base (statistiques du tableau de bord,
+séries analytiques, KPIs de stock, périmètres régionaux, filtres des
+mouvements) :
+
+- GenerationCache : lecture/écriture dans le cache de l'application
+  (Flask-Caching, partagé entre processus) avec repli sur un dictionnaire en
+  mémoire ; invalidate() incrémente un compteur de génération, ce qui rend
+  périmées toutes les entrées calculées avec l'ancienne valeur
+- ChangeTracker : après un flush, note dans la session si un modèle suivi a
+  été inséré, supprimé ou modifié (éventuellement sur certaines colonnes
+  seulement) ; l'invalidation a lieu au commit, un rollback l'annule
+"""
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+
+class GenerationCache:
+    """Entrées en cache d'un module et leur compteur de génération"""
+
+    def __init__(self, generation_key, timeout=None):
+        self.generation_key = generation_key
+        self.timeout = timeout
+        # Repli en mémoire si Flask-Caching n'est pas disponible
+        self.local = {}
+
+    @staticmethod
+    def backend():
+        try:
+            from flask import current_app
+            return getattr(current_app, 'cache', None)
+        except RuntimeError:
+            return None
+
+    def get(self, key):
+        cache = self.backend()
+        if cache is not None:
+            return cache.get(key)
+        return self.local.get(key)
+
+    def get_many(self, keys):
+        cache = self.backend()
+        if cache is not None:
+            return dict(zip(keys, cache.get_many(*keys)))
+        return {key: self.local.get(key) for key in keys}
+
+    def set(self, key, value, timeout=None):
+        cache = self.backend()
+        if cache is not None:
+            cache.set(key, value, timeout=self.timeout if timeout is None else timeout)
+        else:
+            self.local[key] = value
+
+    def generation(self):
+        return self.get(self.generation_key) or 0
+
+    def invalidate(self):
+        """Nouvelle génération (tous processus si le cache est partagé)"""
+        cache = self.backend()
+        if cache is not None:
+            try:
+                if cache.inc(self.generation_key) is not None:
+                    return
+            except Exception:
+                pass
+        self.set(self.generation_key, self.generation() + 1, timeout=0)
+
+
+class ChangeTracker:
+    """
+    Appelle on_commit() après le commit d'une transaction qui a touché un modèle suivi
+
+    Args:
+        flag: Clé posée dans session.info entre le flush et le commit
+        on_commit: Invalidation à exécuter
+        label: Nom des données invalidées (message d'erreur)
+        models: Modèles dont toute insertion, modification ou suppression compte
+        attributes: {Modèle: (colonnes)} : insertions et suppressions, et
+                    modifications de ces colonnes seulement
+    """
+
+    def __init__(self, flag, on_commit, label, models=(), attributes=None):
+        self.flag = flag
+        self.on_commit = on_commit
+        self.label = label
+        self.models = tuple(models)
+        self.attributes = dict(attributes or {})
+        self._watched = self.models + tuple(self.attributes)
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def mark_dirty(self, session):
+        """Invalide au prochain commit (écritures hors ORM : insert / update groupés)"""
+        session.info[self.flag] = True
+
+    def _changed(self, session):
+        for instance in list(session.new) + list(session.deleted):
+            if isinstance(instance, self._watched):
+                return True
+        for instance in session.dirty:
+            if isinstance(instance, self.models):
+                return True
+            attributes = self.attributes.get(type(instance))
+            if attributes:
+                state = inspect(instance)
+                if any(state.attrs[name].history.has_changes() for name in attributes):
+                    return True
+        return False
+
+    def _after_flush(self, session, flush_context):
+        if not session.info.get(self.flag) and self._changed(session):
+            session.info[self.flag] = True
+
+    def _after_commit(self, session):
+        if session.info.pop(self.flag, False):
+            try:
+                self.on_commit()
+            except Exception as e:
+                # Hors contexte d'application (scripts) : rien à invalider
+                print(f"⚠️ Invalidation des {self.label} impossible: {e}")
+
+    def _after_rollback(self, session):
+        session.info.pop(self.flag, None)
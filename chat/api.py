@@ -14,6 +14,7 @@ from models import (
 )
 from auth import has_permission
 from . import chat_bp
+from . import events
 from .utils import save_chat_file, get_file_url, format_file_size
 
 # Exempter les routes API du CSRF si CSRF est activé
@@ -446,6 +447,10 @@ def api_message_create(room_id):
     
     db.session.commit()
     
+    # Notifier les streams SSE abonnés (salon + listes de conversations)
+    events.publish_new_message(message)
+    events.publish_room_read(room_id, current_user.id)
+    
     # Formater les attachments comme dans format_message_for_sse
     formatted_attachments = []
     for att_data in attachments_data:
@@ -539,6 +544,7 @@ def api_message_update(message_id):
     message.is_edited = True
     message.edited_at = datetime.now(UTC)
     db.session.commit()
+    events.publish_message_updated(message)
     
     return jsonify({
         'id': message.id,
@@ -566,6 +572,7 @@ def api_message_delete(message_id):
     message.deleted_at = datetime.now(UTC)
     message.content = '[Message supprimé]'
     db.session.commit()
+    events.publish_message_deleted(message)
     
     return jsonify({'message': 'Message supprimé'}), 200
 
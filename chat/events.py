@@ -0,0 +1,255 @@
+# chat/events.py
+# Bus d'événements publish/subscribe pour le chat temps réel
+#
+# Les routes API publient (nouveau message, modification, suppression, lecture)
+# et les streams SSE restent bloqués sur leur abonnement au lieu d'interroger
+# la base en boucle : la charge DB ne dépend plus du nombre d'onglets ouverts.
+#
+# - Backend Redis (REDIS_URL, comme Flask-Caching) : un seul abonnement
+#   Pub/Sub par processus, redistribué localement aux abonnés SSE
+# - Backend en mémoire (dev / mono-nœud) : distribution directe entre threads
+
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, UTC
+
+CHANNEL = 'chat:events'
+
+# Types d'événements publiés
+EVENT_NEW_MESSAGE = 'new_message'
+EVENT_MESSAGE_UPDATED = 'message_updated'
+EVENT_MESSAGE_DELETED = 'message_deleted'
+EVENT_ROOM_READ = 'room_read'
+
+# Taille max de la file d'un abonné (un client trop lent perd les plus anciens événements)
+SUBSCRIBER_QUEUE_SIZE = 500
+
+
+class Subscription:
+    """Abonnement d'un stream SSE : file locale filtrée par salon et/ou utilisateur"""
+
+    def __init__(self, bus, room_id=None, user_id=None):
+        self._bus = bus
+        self.room_id = room_id
+        self.user_id = user_id
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def matches(self, event):
+        if self.room_id is not None and event.get('room_id') != self.room_id:
+            return False
+        if self.user_id is not None and self.user_id not in (event.get('recipient_ids') or []):
+            return False
+        return True
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Abandonner l'événement le plus ancien plutôt que bloquer l'émetteur
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def get(self, timeout=None):
+        """Attend le prochain événement ; retourne None si le délai expire"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class InMemoryEventBus:
+    """Bus en mémoire : valable uniquement au sein d'un même processus"""
+
+    backend = 'memory'
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, room_id=None, user_id=None):
+        subscription = Subscription(self, room_id=room_id, user_id=user_id)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def dispatch(self, event):
+        """Distribue un événement aux abonnés locaux concernés"""
+        with self._lock:
+            targets = [s for s in self._subscribers if s.matches(event)]
+        for subscription in targets:
+            subscription.put(event)
+
+    def publish(self, event):
+        self.dispatch(event)
+
+
+class RedisEventBus(InMemoryEventBus):
+    """Bus Redis Pub/Sub : les événements traversent les workers et les nœuds"""
+
+    backend = 'redis'
+
+    def __init__(self, redis_url):
+        super().__init__()
+        import redis
+        self._redis = redis.Redis.from_url(redis_url)
+        self._redis.ping()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='chat-events-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for raw in pubsub.listen():
+                    if raw.get('type') != 'message':
+                        continue
+                    try:
+                        event = json.loads(raw['data'])
+                    except (TypeError, ValueError):
+                        continue
+                    self.dispatch(event)
+            except Exception as e:
+                print(f"⚠️ Bus d'événements chat: connexion Redis perdue ({e}), nouvelle tentative dans 2s")
+                time.sleep(2)
+
+    def subscribe(self, room_id=None, user_id=None):
+        self._ensure_listener()
+        return super().subscribe(room_id=room_id, user_id=user_id)
+
+    def publish(self, event):
+        try:
+            self._redis.publish(CHANNEL, json.dumps(event))
+        except Exception as e:
+            # Redis indisponible : au moins servir les abonnés de ce processus
+            print(f"⚠️ Publication Redis impossible ({e}), diffusion locale uniquement")
+            self.dispatch(event)
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_event_bus():
+    """Retourne le bus du processus (Redis si REDIS_URL est configuré, sinon mémoire)"""
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                redis_url = os.getenv('REDIS_URL', '')
+                if redis_url and redis_url != 'memory://' and redis_url.startswith(('redis://', 'rediss://')):
+                    try:
+                        _bus = RedisEventBus(redis_url)
+                        print(f"✅ Bus d'événements chat Redis: {redis_url}")
+                    except Exception as e:
+                        print(f"⚠️ Redis indisponible pour le bus chat ({e}), repli en mémoire")
+                if _bus is None:
+                    _bus = InMemoryEventBus()
+    return _bus
+
+
+def set_event_bus(bus):
+    """Remplace le bus du processus (tests)"""
+    global _bus
+    _bus = bus
+
+
+def subscribe(room_id=None, user_id=None):
+    return get_event_bus().subscribe(room_id=room_id, user_id=user_id)
+
+
+def publish(event_type, room_id, recipient_ids=None, **payload):
+    """Publie un événement ; ne doit jamais faire échouer la requête appelante"""
+    event = dict(payload)
+    event['type'] = event_type
+    event['room_id'] = room_id
+    event['recipient_ids'] = list(recipient_ids or [])
+    event.setdefault('timestamp', datetime.now(UTC).isoformat())
+    try:
+        get_event_bus().publish(event)
+    except Exception as e:
+        print(f"⚠️ Erreur publication événement chat {event_type}: {e}")
+    return event
+
+
+def _room_member_ids(room_id):
+    from models import ChatRoomMember
+    return [user_id for (user_id,) in ChatRoomMember.query.with_entities(ChatRoomMember.user_id)
+            .filter_by(room_id=room_id).all()]
+
+
+def publish_new_message(message):
+    """Nouveau message : payload complet pour les salons, résumé pour les listes"""
+    from .sse import format_message_for_sse
+    data = format_message_for_sse(message)
+    data.pop('room_id', None)
+    return publish(
+        EVENT_NEW_MESSAGE,
+        message.room_id,
+        recipient_ids=_room_member_ids(message.room_id),
+        **data
+    )
+
+
+def publish_message_updated(message):
+    return publish(
+        EVENT_MESSAGE_UPDATED,
+        message.room_id,
+        id=message.id,
+        sender_id=message.sender_id,
+        content=message.content,
+        is_edited=message.is_edited,
+        edited_at=message.edited_at.isoformat() if message.edited_at else None
+    )
+
+
+def publish_message_deleted(message):
+    return publish(
+        EVENT_MESSAGE_DELETED,
+        message.room_id,
+        id=message.id,
+        sender_id=message.sender_id,
+        content=message.content,
+        is_edited=message.is_edited
+    )
+
+
+def publish_room_read(room_id, user_id):
+    """Un utilisateur a lu un salon : remet à zéro son compteur de non lus"""
+    return publish(EVENT_ROOM_READ, room_id, recipient_ids=[user_id], user_id=user_id)
+
+
+def format_sse(data):
+    return f"data: {json.dumps(data)}\n\n"
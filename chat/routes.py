@@ -13,6 +13,7 @@ from auth import has_permission, require_permission
 from sqlalchemy.orm import joinedload, aliased
 from sqlalchemy import func, case, or_, and_, desc
 from . import chat_bp
+from . import events
 
 
 @chat_bp.route('/')
@@ -304,6 +305,7 @@ def room_detail(room_id):
             db.session.add(read)
     
     db.session.commit()
+    events.publish_room_read(room_id, current_user.id)
     
     # Pour les conversations directes, récupérer l'autre utilisateur
     other_user = None
@@ -375,6 +377,8 @@ def api_bulk_mark_read():
             marked_count += 1
         
         db.session.commit()
+        for membership in memberships:
+            events.publish_room_read(membership.room_id, current_user.id)
         
         return jsonify({
             'success': True,
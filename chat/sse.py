@@ -5,6 +5,7 @@ from flask import Response, stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime, UTC
 import json
+import os
 import time
 from models import (
     db, ChatRoom, ChatRoomMember, ChatMessage, ChatAttachment,
@@ -12,6 +13,26 @@ from models import (
 )
 from auth import has_permission
 from . import chat_bp
+from . import events
+
+# Délai d'attente d'un événement avant d'envoyer un heartbeat (timeout Gunicorn : 300s)
+HEARTBEAT_INTERVAL = 10
+
+# Durée maximale d'un stream, juste sous le timeout Gunicorn (300s) : le générateur se
+# termine et EventSource se reconnecte, ce qui libère régulièrement les workers synchrones
+STREAM_MAX_DURATION = int(os.getenv('CHAT_STREAM_MAX_DURATION', '280'))
+# Délai de reconnexion indiqué au navigateur (millisecondes)
+RECONNECT_DELAY_MS = 1000
+
+
+def _stream_events(subscription):
+    """Événements reçus par l'abonnement (None : heartbeat à envoyer) jusqu'à STREAM_MAX_DURATION"""
+    deadline = time.monotonic() + STREAM_MAX_DURATION
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        yield subscription.get(timeout=min(HEARTBEAT_INTERVAL, remaining))
 
 
 def format_message_for_sse(message):
@@ -51,7 +72,7 @@ def format_message_for_sse(message):
 @chat_bp.route('/api/stream/<int:room_id>')
 @login_required
 def stream_messages(room_id):
-    """Stream Server-Sent Events pour les nouveaux messages"""
+    """Stream Server-Sent Events pour les nouveaux messages (abonnement au bus, sans polling DB)"""
     if not has_permission(current_user, 'chat.read'):
         return Response('Permission refusée', status=403, mimetype='text/plain')
     
@@ -60,57 +81,30 @@ def stream_messages(room_id):
     if not membership:
         return Response('Accès refusé', status=403, mimetype='text/plain')
     
+    # Libérer la connexion DB : le stream ne lit plus la base
+    db.session.close()
+    
     def event_stream():
         """Générateur pour les événements SSE"""
-        last_message_id = None
-        last_check = datetime.now(UTC)
-        
-        # Envoyer un message de connexion
-        yield f"data: {json.dumps({'type': 'connected', 'timestamp': datetime.now(UTC).isoformat()})}\n\n"
-        
+        subscription = events.subscribe(room_id=room_id)
         try:
-            iteration = 0
-            while True:
-                iteration += 1
-                
-                # Envoyer un heartbeat toutes les 10 secondes pour éviter le timeout Gunicorn
-                # (Gunicorn timeout par défaut est 30s, on envoie un heartbeat toutes les 10s)
-                if iteration % 10 == 0:  # Toutes les 10 itérations (10 * 1s = 10s)
-                    yield f"data: {json.dumps({'type': 'heartbeat', 'timestamp': datetime.now(UTC).isoformat()})}\n\n"
-                    last_check = datetime.now(UTC)
-                
-                # Récupérer les nouveaux messages depuis le dernier check avec les relations
-                from sqlalchemy.orm import joinedload
-                query = ChatMessage.query.filter_by(room_id=room_id, is_deleted=False)\
-                    .options(joinedload(ChatMessage.reply_to).joinedload(ChatMessage.sender))\
-                    .options(joinedload(ChatMessage.sender))\
-                    .options(joinedload(ChatMessage.attachments))
-                
-                if last_message_id:
-                    query = query.filter(ChatMessage.id > last_message_id)
-                else:
-                    # Pour la première connexion, récupérer les messages depuis le dernier check
-                    query = query.filter(ChatMessage.created_at > last_check)
-                
-                new_messages = query.order_by(ChatMessage.created_at.asc()).all()
+            # Envoyer un message de connexion (et le délai de reconnexion en fin de stream)
+            yield f"retry: {RECONNECT_DELAY_MS}\n" + \
+                events.format_sse({'type': 'connected', 'timestamp': datetime.now(UTC).isoformat()})
+            
+            for event in _stream_events(subscription):
+                if event is None:
+                    # Heartbeat pour éviter les timeouts Gunicorn / proxy
+                    yield events.format_sse({'type': 'heartbeat', 'timestamp': datetime.now(UTC).isoformat()})
+                    continue
                 
-                for message in new_messages:
-                    # Envoyer TOUS les messages (le client décidera s'il doit les afficher)
-                    message_data = format_message_for_sse(message)
-                    message_data['type'] = 'new_message'
-                    yield f"data: {json.dumps(message_data)}\n\n"
-                    
-                    # Mettre à jour le dernier message ID
-                    if not last_message_id or message.id > last_message_id:
-                        last_message_id = message.id
+                if event['type'] not in (events.EVENT_NEW_MESSAGE, events.EVENT_MESSAGE_UPDATED,
+                                         events.EVENT_MESSAGE_DELETED):
+                    continue
                 
-                # Sleep après avoir envoyé les données pour éviter de bloquer trop longtemps
-                # Utiliser un sleep plus court et gérer les interruptions
-                try:
-                    time.sleep(1)  # Vérifier toutes les 1 seconde
-                except (KeyboardInterrupt, SystemExit):
-                    # Interruption par Gunicorn (timeout ou shutdown)
-                    break
+                # Envoyer TOUS les messages (le client décidera s'il doit les afficher)
+                data = {k: v for k, v in event.items() if k != 'recipient_ids'}
+                yield events.format_sse(data)
                 
         except GeneratorExit:
             # Connexion fermée par le client
@@ -121,9 +115,11 @@ def stream_messages(room_id):
         except Exception as e:
             print(f"⚠️ Erreur dans le stream SSE: {e}")
             try:
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+                yield events.format_sse({'type': 'error', 'message': str(e)})
             except:
                 pass  # Ignorer si le générateur est déjà fermé
+        finally:
+            subscription.close()
     
     return Response(
         stream_with_context(event_stream()),
@@ -136,6 +132,78 @@ def stream_messages(room_id):
     )
 
 
+def count_unread_messages(room_id, user_id, last_read_at=None):
+    """Nombre de messages non lus d'un salon pour un utilisateur"""
+    query = ChatMessage.query.filter_by(room_id=room_id, is_deleted=False)\
+        .filter(ChatMessage.sender_id != user_id)
+    if last_read_at:
+        query = query.filter(ChatMessage.created_at > last_read_at)
+    return query.count()
+
+
+def _room_update(room_id, last_message, unread_count):
+    return {
+        'type': 'room_update',
+        'room_id': room_id,
+        'last_message': last_message,
+        'unread_count': unread_count
+    }
+
+
+def _initial_room_updates(user_id):
+    """État initial des conversations (une seule passe de requêtes à la connexion)"""
+    from sqlalchemy.orm import joinedload
+    from sqlalchemy import func, and_
+    
+    memberships = ChatRoomMember.query.filter_by(user_id=user_id).all()
+    room_ids = [m.room_id for m in memberships]
+    if not room_ids:
+        return {}, []
+    
+    # Derniers messages reçus (hors expéditeur) de toutes les rooms en une seule requête
+    last_msg_subq = db.session.query(
+        ChatMessage.room_id,
+        func.max(ChatMessage.id).label('max_id')
+    ).filter_by(is_deleted=False)\
+     .filter(ChatMessage.sender_id != user_id)\
+     .filter(ChatMessage.room_id.in_(room_ids))\
+     .group_by(ChatMessage.room_id).subquery()
+    
+    latest_messages = db.session.query(ChatMessage).join(
+        last_msg_subq,
+        and_(
+            ChatMessage.room_id == last_msg_subq.c.room_id,
+            ChatMessage.id == last_msg_subq.c.max_id
+        )
+    ).options(joinedload(ChatMessage.sender)).all()
+    
+    # Non lus par room en une seule requête groupée
+    unread_rows = db.session.query(ChatMessage.room_id, func.count(ChatMessage.id))\
+        .join(ChatRoomMember, and_(
+            ChatRoomMember.room_id == ChatMessage.room_id,
+            ChatRoomMember.user_id == user_id
+        ))\
+        .filter(ChatMessage.room_id.in_(room_ids))\
+        .filter(ChatMessage.is_deleted == False)\
+        .filter(ChatMessage.sender_id != user_id)\
+        .filter(db.or_(ChatRoomMember.last_read_at.is_(None),
+                       ChatMessage.created_at > ChatRoomMember.last_read_at))\
+        .group_by(ChatMessage.room_id).all()
+    unread_counts = {room_id: 0 for room_id in room_ids}
+    unread_counts.update({room_id: count for room_id, count in unread_rows})
+    
+    updates = [
+        _room_update(msg.room_id, {
+            'id': msg.id,
+            'content': msg.content[:100],
+            'sender_name': msg.sender.username,
+            'created_at': msg.created_at.isoformat()
+        }, unread_counts.get(msg.room_id, 0))
+        for msg in latest_messages
+    ]
+    return unread_counts, updates
+
+
 @chat_bp.route('/api/stream/rooms')
 @login_required
 def stream_rooms():
@@ -143,105 +211,49 @@ def stream_rooms():
     if not has_permission(current_user, 'chat.read'):
         return Response('Permission refusée', status=403, mimetype='text/plain')
     
+    user_id = current_user.id
+    
     def event_stream():
         """Générateur pour les événements SSE des conversations"""
-        last_check = datetime.now(UTC)
-        last_room_updates = {}  # {room_id: last_message_id}
-        
-        # Envoyer un message de connexion
-        yield f"data: {json.dumps({'type': 'connected', 'timestamp': datetime.now(UTC).isoformat()})}\n\n"
-        
+        # S'abonner avant la lecture initiale pour ne perdre aucun événement
+        subscription = events.subscribe(user_id=user_id)
         try:
-            iteration = 0
-            while True:
-                iteration += 1
-                
-                # Envoyer un heartbeat toutes les 10 secondes pour éviter le timeout Gunicorn
-                # (Gunicorn timeout par défaut est 30s, on envoie un heartbeat toutes les 10s)
-                if iteration % 5 == 0:  # Toutes les 5 itérations (5 * 2s = 10s)
-                    yield f"data: {json.dumps({'type': 'heartbeat', 'timestamp': datetime.now(UTC).isoformat()})}\n\n"
-                    last_check = datetime.now(UTC)
-                
-                # Récupérer toutes les conversations de l'utilisateur (optimisé)
-                from sqlalchemy.orm import joinedload
-                memberships = ChatRoomMember.query.filter_by(user_id=current_user.id).all()
-                room_ids = [m.room_id for m in memberships]
-                
-                if not room_ids:
-                    # Envoyer un heartbeat même si pas de rooms pour maintenir la connexion
-                    time.sleep(2)
+            unread_counts, initial_updates = _initial_room_updates(user_id)
+            db.session.close()
+            
+            # Envoyer un message de connexion (et le délai de reconnexion en fin de stream)
+            yield f"retry: {RECONNECT_DELAY_MS}\n" + \
+                events.format_sse({'type': 'connected', 'timestamp': datetime.now(UTC).isoformat()})
+            for update in initial_updates:
+                yield events.format_sse(update)
+            
+            for event in _stream_events(subscription):
+                if event is None:
+                    yield events.format_sse({'type': 'heartbeat', 'timestamp': datetime.now(UTC).isoformat()})
                     continue
                 
-                # OPTIMISATION: Récupérer tous les derniers messages en une seule requête
-                from sqlalchemy import func, and_
-                last_msg_subq = db.session.query(
-                    ChatMessage.room_id,
-                    func.max(ChatMessage.id).label('max_id')
-                ).filter_by(is_deleted=False)\
-                 .filter(ChatMessage.sender_id != current_user.id)\
-                 .filter(ChatMessage.room_id.in_(room_ids))\
-                 .group_by(ChatMessage.room_id).subquery()
-                
-                # Récupérer les derniers messages avec sender en une seule requête
-                latest_messages = db.session.query(ChatMessage).join(
-                    last_msg_subq,
-                    and_(
-                        ChatMessage.room_id == last_msg_subq.c.room_id,
-                        ChatMessage.id == last_msg_subq.c.max_id
-                    )
-                ).options(joinedload(ChatMessage.sender)).all()
-                
-                latest_message_map = {msg.room_id: msg for msg in latest_messages}
-                
-                # OPTIMISATION: Récupérer tous les membres avec last_read_at en une seule requête
-                memberships_map = {m.room_id: m for m in memberships}
-                
-                # OPTIMISATION: Compter les non lus pour toutes les rooms en une seule requête
-                # Utiliser une sous-requête pour compter les non lus par room
-                for room_id in room_ids:
-                    last_message_id = last_room_updates.get(room_id, 0)
-                    latest_message = latest_message_map.get(room_id)
-                    
-                    # Vérifier s'il y a de nouveaux messages
-                    if latest_message and latest_message.id > last_message_id:
-                        last_room_updates[room_id] = latest_message.id
-                        
-                        # Compter les non lus (optimisé)
-                        membership = memberships_map.get(room_id)
-                        last_read = membership.last_read_at if membership else None
-                        
-                        if last_read:
-                            unread_count = ChatMessage.query.filter_by(room_id=room_id)\
-                                .filter(ChatMessage.created_at > last_read)\
-                                .filter_by(is_deleted=False)\
-                                .filter(ChatMessage.sender_id != current_user.id)\
-                                .count()
-                        else:
-                            unread_count = ChatMessage.query.filter_by(room_id=room_id)\
-                                .filter_by(is_deleted=False)\
-                                .filter(ChatMessage.sender_id != current_user.id)\
-                                .count()
-                        
-                        # Envoyer la mise à jour
-                        yield f"data: {json.dumps({
-                            'type': 'room_update',
-                            'room_id': room_id,
-                            'last_message': {
-                                'id': latest_message.id,
-                                'content': latest_message.content[:100],
-                                'sender_name': latest_message.sender.username,
-                                'created_at': latest_message.created_at.isoformat()
-                            },
-                            'unread_count': unread_count
-                        })}\n\n"
-                
-                # Sleep après avoir envoyé les données pour éviter de bloquer trop longtemps
-                # Utiliser un sleep plus court et gérer les interruptions
-                try:
-                    time.sleep(2)  # Vérifier toutes les 2 secondes
-                except (KeyboardInterrupt, SystemExit):
-                    # Interruption par Gunicorn (timeout ou shutdown)
-                    return
+                room_id = event['room_id']
+                if event['type'] == events.EVENT_NEW_MESSAGE:
+                    if event.get('sender_id') == user_id:
+                        continue
+                    if room_id in unread_counts:
+                        unread_counts[room_id] += 1
+                    else:
+                        # Conversation rejointe après la connexion : compter une seule fois
+                        membership = ChatRoomMember.query.filter_by(room_id=room_id, user_id=user_id).first()
+                        unread_counts[room_id] = count_unread_messages(
+                            room_id, user_id, membership.last_read_at if membership else None
+                        )
+                        db.session.close()
+                    yield events.format_sse(_room_update(room_id, {
+                        'id': event['id'],
+                        'content': (event.get('content') or '')[:100],
+                        'sender_name': event.get('sender_name'),
+                        'created_at': event.get('created_at')
+                    }, unread_counts[room_id]))
+                elif event['type'] == events.EVENT_ROOM_READ:
+                    unread_counts[room_id] = 0
+                    yield events.format_sse(_room_update(room_id, None, 0))
                 
         except GeneratorExit:
             pass
@@ -251,9 +263,11 @@ def stream_rooms():
         except Exception as e:
             print(f"⚠️ Erreur dans le stream SSE rooms: {e}")
             try:
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+                yield events.format_sse({'type': 'error', 'message': str(e)})
             except:
                 pass  # Ignorer si le générateur est déjà fermé
+        finally:
+            subscription.close()
     
     return Response(
         stream_with_context(event_stream()),
@@ -264,4 +278,3 @@ def stream_rooms():
             'Connection': 'keep-alive'
         }
     )
-
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fixtures communes des tests
+
+- app : application Flask minimale (Flask-SQLAlchemy, Flask-Login) sur une base
+  SQLite sur fichier, créée puis supprimée à chaque test ; plusieurs connexions
+  réelles sont possibles (threads, workers, connexion séparée de job_queue).
+  Un module la complète en redéfinissant la fixture : @pytest.fixture
+  def app(app): ... (données, blueprints, caches à vider)
+- seed : ajout des données de référence courantes. Les identifiants sont
+  explicites : les BIGINT ne sont pas auto-incrémentés sous SQLite
+"""
+
+import pytest
+from flask import Flask
+from flask_login import LoginManager
+
+from models import db, User, Role, Region, Family, Depot, Vehicle, StockItem
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'tests.db'}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+    app.config['SECRET_KEY'] = 'test'
+    db.init_app(app)
+    login_manager = LoginManager(app)
+    login_manager.user_loader(lambda user_id: db.session.get(User, int(user_id)))
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+class Seed:
+    """Données de référence ajoutées à la session (le test décide du commit)"""
+
+    @staticmethod
+    def _add(*instances):
+        db.session.add_all(instances)
+        return instances[0] if len(instances) == 1 else list(instances)
+
+    def role(self, id=1, code='commercial', name='Commercial', **values):
+        return self._add(Role(id=id, code=code, name=name, permissions={}, **values))
+
+    def region(self, id, name, **values):
+        return self._add(Region(id=id, name=name, **values))
+
+    def user(self, id=1, username='admin', **values):
+        values.setdefault('email', f'{username}@example.com')
+        return self._add(User(id=id, username=username, password_hash='x', **values))
+
+    def family(self, id=1, name='Froid'):
+        return self._add(Family(id=id, name=name))
+
+    def depot(self, id, name=None, **values):
+        return self._add(Depot(id=id, name=name or f'Dépôt {id}', **values))
+
+    def vehicle(self, id=1, plate_number='AA-001', **values):
+        return self._add(Vehicle(id=id, plate_number=plate_number, **values))
+
+    def stock_items(self, ids, family_id=1, **values):
+        """Articles SKU-<id> / Article <id>"""
+        return [self._add(StockItem(id=i, sku=f'SKU-{i}', name=f'Article {i}', family_id=family_id, **values))
+                for i in ids]
+
+
+@pytest.fixture
+def seed():
+    return Seed()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Moteur de statistiques du tableau de bord (page d'accueil)
+
+- Les ~40 compteurs sont calculés en quelques requêtes (une par domaine) :
+  chaque requête est un SELECT de sous-requêtes scalaires ou d'agrégats
+  conditionnels, le filtrage par région passe par des sous-requêtes
+  (plus de chargement des véhicules pour construire des listes IN)
+- Cache stale-while-revalidate : une entrée périmée est servie immédiatement
+  pendant qu'un thread la recalcule ; seul un tout premier accès sans aucune
+  entrée calcule de façon synchrone (et le démarrage préchauffe les entrées)
+- Invalidation par événements : un commit touchant un modèle suivi incrémente
+  la génération du cache, ce qui rend toutes les entrées périmées
+"""
+
+import threading
+import time
+from datetime import date, datetime, timedelta, UTC
+
+from sqlalchemy import case, func, or_, and_, select
+
+from cache_generations import ChangeTracker, GenerationCache
+from models import (
+    db, Category, Article, Simulation, Region, Depot, Vehicle, Family, StockItem,
+    InventorySession, StockMovement, Reception, VehicleDocument, VehicleMaintenance,
+    DepotStock, VehicleStock, PriceList, User, Employee, EmployeeContract,
+    EmployeeTraining, EmployeeAbsence, CommercialOrder, PromotionTeam,
+    PromotionMember, PromotionSale, PromotionGamme, PromotionReturn
+)
+from utils_region_filter import (
+    region_depot_ids_subquery, region_vehicle_ids_subquery, stock_movement_region_condition
+)
+
+CACHE_KEY_PREFIX = 'dashboard_stats_'
+GENERATION_KEY = 'dashboard_stats_generation'
+
+# Âge au-delà duquel une entrée est recalculée en arrière-plan (secondes)
+SOFT_TTL = 600
+# Durée de vie maximale d'une entrée dans le cache (servie périmée jusque-là)
+HARD_TTL = 24 * 3600
+
+# Modèles dont un commit invalide les statistiques
+WATCHED_MODELS = (
+    Category, Article, Simulation, Region, Depot, Vehicle, Family, StockItem,
+    InventorySession, StockMovement, Reception, VehicleDocument, VehicleMaintenance,
+    DepotStock, VehicleStock, PriceList, Employee, EmployeeContract,
+    EmployeeTraining, EmployeeAbsence, CommercialOrder, PromotionTeam,
+    PromotionMember, PromotionSale, PromotionGamme, PromotionReturn
+)
+
+# Modèles suivis seulement sur les colonnes utilisées par les compteurs
+# (une connexion qui met à jour User.last_login n'invalide rien)
+WATCHED_ATTRIBUTES = {User: ('is_active', 'region_id')}
+
+# Entrées en cache (cache partagé de l'application, sinon mémoire du processus)
+_store = GenerationCache(GENERATION_KEY, timeout=HARD_TTL)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def cache_key(region_id):
+    return f'{CACHE_KEY_PREFIX}{region_id if region_id else "all"}'
+
+
+def invalidate():
+    """Rend toutes les entrées périmées (elles restent servies pendant leur recalcul)"""
+    _store.invalidate()
+
+
+# =========================================================
+# CALCUL GROUPÉ DES COMPTEURS
+# =========================================================
+
+def _count(model, *conditions):
+    query = select(func.count()).select_from(model)
+    if conditions:
+        query = query.where(*conditions)
+    return query.scalar_subquery()
+
+
+def _fetch(**columns):
+    """Exécute un seul SELECT de sous-requêtes scalaires et retourne un dict d'entiers"""
+    row = db.session.execute(select(*[expr.label(name) for name, expr in columns.items()])).one()
+    return {name: int(value or 0) for name, value in row._mapping.items()}
+
+
+def _global_stats():
+    """Référentiels non filtrés par région"""
+    return _fetch(
+        categories_count=_count(Category),
+        articles_count=_count(Article),
+        simulations_count=_count(Simulation),
+        completed_simulations=_count(Simulation, Simulation.is_completed == True),
+        regions_count=_count(Region),
+        families_count=_count(Family),
+        stock_items_count=_count(StockItem, StockItem.is_active == True),
+        price_lists_count=_count(PriceList),
+        price_lists_active=_count(PriceList, PriceList.is_active == True),
+    )
+
+
+def _stock_stats(region_id, seven_days_ago):
+    """Dépôts, véhicules, mouvements, réceptions, stocks, inventaires et flotte"""
+    if region_id is None:
+        return _fetch(
+            depots_count=_count(Depot, Depot.is_active == True),
+            vehicles_count=_count(Vehicle, Vehicle.status == 'active'),
+            movements_count=_count(StockMovement),
+            receptions_count=_count(Reception),
+            depot_stocks_count=_count(DepotStock),
+            vehicle_stocks_count=_count(VehicleStock),
+            inventory_sessions_count=_count(InventorySession),
+            inventory_pending=_count(InventorySession, InventorySession.status == 'draft'),
+            documents_count=_count(VehicleDocument),
+            maintenances_planned=_count(VehicleMaintenance, VehicleMaintenance.status == 'planned'),
+            recent_movements=_count(StockMovement, StockMovement.movement_date >= seven_days_ago),
+            recent_receptions=_count(Reception, Reception.reception_date >= seven_days_ago),
+            recent_sessions=_count(InventorySession, InventorySession.session_date >= seven_days_ago),
+        )
+
+    depot_ids = region_depot_ids_subquery(region_id)
+    vehicle_ids = region_vehicle_ids_subquery(region_id)
+    movement_in_region = stock_movement_region_condition(region_id)
+    active_region_vehicles = select(func.count()).select_from(Vehicle)\
+        .join(User, Vehicle.current_user_id == User.id)\
+        .where(Vehicle.status == 'active', User.region_id == region_id).scalar_subquery()
+    return _fetch(
+        depots_count=_count(Depot, Depot.is_active == True, Depot.region_id == region_id),
+        vehicles_count=active_region_vehicles,
+        movements_count=_count(StockMovement, movement_in_region),
+        receptions_count=_count(Reception, Reception.depot_id.in_(depot_ids)),
+        depot_stocks_count=_count(DepotStock, DepotStock.depot_id.in_(depot_ids)),
+        vehicle_stocks_count=_count(VehicleStock, VehicleStock.vehicle_id.in_(vehicle_ids)),
+        inventory_sessions_count=_count(InventorySession, InventorySession.depot_id.in_(depot_ids)),
+        inventory_pending=_count(InventorySession, InventorySession.status == 'draft',
+                                 InventorySession.depot_id.in_(depot_ids)),
+        documents_count=_count(VehicleDocument, VehicleDocument.vehicle_id.in_(vehicle_ids)),
+        maintenances_planned=_count(VehicleMaintenance, VehicleMaintenance.status == 'planned',
+                                    VehicleMaintenance.vehicle_id.in_(vehicle_ids)),
+        recent_movements=_count(StockMovement, StockMovement.movement_date >= seven_days_ago, movement_in_region),
+        # Réceptions récentes : non filtrées par région (comportement historique du tableau de bord)
+        recent_receptions=_count(Reception, Reception.reception_date >= seven_days_ago),
+        recent_sessions=_count(InventorySession, InventorySession.session_date >= seven_days_ago,
+                               InventorySession.depot_id.in_(depot_ids)),
+    )
+
+
+def _rh_stats(region_id):
+    """Utilisateurs, employés, contrats, absences et formations"""
+    active_contract = or_(
+        EmployeeContract.status == 'active',
+        and_(EmployeeContract.end_date.is_(None), EmployeeContract.status != 'terminated')
+    )
+    if region_id is None:
+        return _fetch(
+            total_users=_count(User),
+            active_users=_count(User, User.is_active == True),
+            total_employees=_count(Employee),
+            active_employees=_count(Employee, Employee.employment_status == 'active'),
+            active_contracts=_count(EmployeeContract, active_contract),
+            pending_absences=_count(EmployeeAbsence, EmployeeAbsence.status == 'pending'),
+            ongoing_trainings=_count(EmployeeTraining, EmployeeTraining.status == 'in_progress'),
+        )
+
+    region_employees = select(Employee.id).where(Employee.region_id == region_id)
+    return _fetch(
+        total_users=_count(User, User.region_id == region_id),
+        active_users=_count(User, User.is_active == True, User.region_id == region_id),
+        total_employees=_count(Employee, Employee.region_id == region_id),
+        active_employees=_count(Employee, Employee.employment_status == 'active', Employee.region_id == region_id),
+        active_contracts=_count(EmployeeContract, active_contract, EmployeeContract.employee_id.in_(region_employees)),
+        pending_absences=_count(EmployeeAbsence, EmployeeAbsence.status == 'pending',
+                                EmployeeAbsence.employee_id.in_(region_employees)),
+        ongoing_trainings=_count(EmployeeTraining, EmployeeTraining.status == 'in_progress',
+                                 EmployeeTraining.employee_id.in_(region_employees)),
+    )
+
+
+def _orders_stats(region_id):
+    """Commandes commerciales : un seul agrégat conditionnel"""
+    def status_count(status):
+        return func.sum(case((CommercialOrder.status == status, 1), else_=0))
+
+    query = select(
+        func.count(CommercialOrder.id).label('orders_count'),
+        status_count('draft').label('orders_pending'),
+        status_count('validated').label('orders_validated'),
+        # Note: l'enum order_status n'a pas "cancelled", mais "rejected" à la place
+        status_count('rejected').label('orders_rejected'),
+        status_count('completed').label('orders_completed'),
+    )
+    if region_id is not None:
+        query = query.where(CommercialOrder.region_id == region_id)
+    row = db.session.execute(query).one()
+    return {name: int(value or 0) for name, value in row._mapping.items()}
+
+
+def _promotion_stats(region_id, today):
+    """Équipes, membres, gammes, ventes du jour et retours en attente"""
+    if region_id is None:
+        return _fetch(
+            promotion_teams=_count(PromotionTeam, PromotionTeam.is_active == True),
+            promotion_members=_count(PromotionMember, PromotionMember.is_active == True),
+            promotion_gammes=_count(PromotionGamme, PromotionGamme.is_active == True),
+            promotion_sales_today=_count(PromotionSale, PromotionSale.sale_date == today),
+            promotion_returns_pending=_count(PromotionReturn, PromotionReturn.status == 'pending'),
+        )
+
+    region_teams = select(PromotionTeam.id).join(User, PromotionTeam.team_leader_id == User.id)\
+        .where(User.region_id == region_id)
+    region_members = select(PromotionMember.id).where(PromotionMember.team_id.in_(region_teams))
+    return _fetch(
+        promotion_teams=_count(PromotionTeam, PromotionTeam.is_active == True, PromotionTeam.id.in_(region_teams)),
+        promotion_members=_count(PromotionMember, PromotionMember.is_active == True,
+                                 PromotionMember.team_id.in_(region_teams)),
+        promotion_gammes=_count(PromotionGamme, PromotionGamme.is_active == True),
+        promotion_sales_today=_count(PromotionSale, PromotionSale.sale_date == today,
+                                     PromotionSale.member_id.in_(region_members)),
+        promotion_returns_pending=_count(PromotionReturn, PromotionReturn.status == 'pending'),
+    )
+
+
+def compute_dashboard_stats(region_id=None):
+    """
+    Calcule toutes les statistiques du tableau de bord pour une région (None = toutes)
+
+    Chaque domaine est isolé : une erreur (colonne manquante...) met ses compteurs à 0
+    sans empêcher les autres.
+    """
+    seven_days_ago = datetime.now(UTC) - timedelta(days=7)
+    today = date.today()
+
+    stats = {}
+    domains = (
+        ('globaux', _global_stats, (), ('categories_count', 'articles_count', 'simulations_count',
+                                        'completed_simulations', 'regions_count', 'families_count',
+                                        'stock_items_count', 'price_lists_count', 'price_lists_active')),
+        ('stocks', _stock_stats, (region_id, seven_days_ago), ('depots_count', 'vehicles_count', 'movements_count',
+                                                               'receptions_count', 'depot_stocks_count',
+                                                               'vehicle_stocks_count', 'inventory_sessions_count',
+                                                               'inventory_pending', 'documents_count',
+                                                               'maintenances_planned', 'recent_movements',
+                                                               'recent_receptions', 'recent_sessions')),
+        ('RH', _rh_stats, (region_id,), ('total_users', 'active_users', 'total_employees', 'active_employees',
+                                         'active_contracts', 'pending_absences', 'ongoing_trainings')),
+        ('commandes', _orders_stats, (region_id,), ('orders_count', 'orders_pending', 'orders_validated',
+                                                    'orders_rejected', 'orders_completed')),
+        ('promotion', _promotion_stats, (region_id, today), ('promotion_teams', 'promotion_members',
+                                                             'promotion_gammes', 'promotion_sales_today',
+                                                             'promotion_returns_pending')),
+    )
+    for label, compute, args, keys in domains:
+        try:
+            stats.update(compute(*args))
+        except Exception as e:
+            print(f"⚠️ Erreur lors du calcul des statistiques {label}: {e}")
+            db.session.rollback()
+            stats.update({key: 0 for key in keys})
+
+    stats['user_region_id'] = region_id
+    stats['user_region_name'] = None
+    if region_id:
+        stats['user_region_name'] = db.session.execute(
+            select(Region.name).where(Region.id == region_id)
+        ).scalar()
+    return stats
+
+
+# =========================================================
+# CACHE STALE-WHILE-REVALIDATE
+# =========================================================
+
+def refresh(region_id=None):
+    """Recalcule et met en cache les statistiques d'une région"""
+    generation = _store.generation()
+    stats = compute_dashboard_stats(region_id)
+    _store.set(cache_key(region_id), {
+        'stats': stats,
+        'computed_at': time.time(),
+        'generation': generation,
+    })
+    return stats
+
+
+def _refresh_in_background(region_id):
+    """Lance un recalcul en arrière-plan (un seul à la fois par région et par processus)"""
+    from flask import current_app
+    key = cache_key(region_id)
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    app = current_app._get_current_object()
+
+    def run():
+        try:
+            with app.app_context():
+                refresh(region_id)
+        except Exception as e:
+            print(f"⚠️ Erreur lors du recalcul des statistiques du tableau de bord ({key}): {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=run, name=f'refresh-{key}', daemon=True).start()
+
+
+def get_dashboard_stats(region_id=None):
+    """
+    Statistiques du tableau de bord pour une région
+
+    Sert l'entrée en cache même périmée et la recalcule en arrière-plan ;
+    calcule de façon synchrone uniquement si aucune entrée n'existe.
+    """
+    entry = _store.get(cache_key(region_id))
+    if not entry or 'stats' not in entry:
+        return refresh(region_id)
+
+    is_stale = (time.time() - entry.get('computed_at', 0) > SOFT_TTL
+                or entry.get('generation') != _store.generation())
+    if is_stale:
+        _refresh_in_background(region_id)
+    return entry['stats']
+
+
+def warm_up():
+    """Précalcule les entrées (toutes régions + chaque région) ; appelé au démarrage"""
+    refresh(None)
+    region_ids = [region_id for (region_id,) in db.session.execute(select(Region.id)).all()]
+    for region_id in region_ids:
+        refresh(region_id)
+    return len(region_ids) + 1
+
+
+# =========================================================
+# INVALIDATION PAR ÉVÉNEMENTS DE DOMAINE
+# =========================================================
+
+_changes = ChangeTracker('dashboard_stats_dirty', invalidate, 'statistiques du tableau de bord',
+                         models=WATCHED_MODELS, attributes=WATCHED_ATTRIBUTES)
+
+
+def mark_dirty(session):
+    """Invalide les statistiques au prochain commit (écritures hors ORM : insert / update groupés)"""
+    _changes.mark_dirty(session)
@@ -7,6 +7,10 @@ from .db_adapter import (
     check_table_exists,
     get_table_columns,
     adapt_sql_query,
+    translate_statement,
+    get_translation_stats,
+    reset_translation_stats,
+    is_orm_compiled,
     clear_cache,
     get_db_info,
     setup_sqlalchemy_middleware
@@ -20,6 +24,10 @@ __all__ = [
     'check_table_exists',
     'get_table_columns',
     'adapt_sql_query',
+    'translate_statement',
+    'get_translation_stats',
+    'reset_translation_stats',
+    'is_orm_compiled',
     'clear_cache',
     'get_db_info',
     'setup_sqlalchemy_middleware'
@@ -5,9 +5,14 @@ Module d'adaptation automatique MySQL → PostgreSQL
 Détecte le type de base de données et adapte les requêtes SQL en conséquence
 """
 
+import os
 import re
+import time
 import logging
+import threading
+from collections import OrderedDict
 from sqlalchemy import text, inspect
+from sqlalchemy.sql.elements import TextClause
 from sqlalchemy.engine import Engine
 from sqlalchemy.event import listens_for
 
@@ -291,92 +296,205 @@ def get_table_columns(table_name, db_session=None):
 # CONVERSION DE REQUÊTES SQL
 # =========================================================
 
-def adapt_sql_query(sql_query, db_session=None):
-    """
-    Adapte une requête SQL MySQL vers PostgreSQL si nécessaire
-    
-    Args:
-        sql_query: Requête SQL à adapter
-        db_session: Session SQLAlchemy (optionnel)
-    
-    Returns:
-        str: Requête SQL adaptée
-    """
-    if not is_postgresql(db_session):
+# Expressions compilées une seule fois (et non à chaque requête)
+_INFORMATION_SCHEMA_PATTERN = re.compile(
+    r'INFORMATION_SCHEMA\.COLUMNS\s+WHERE\s+TABLE_SCHEMA\s*=\s*DATABASE\(\)',
+    re.IGNORECASE
+)
+_IDENTIFIER_PATTERNS = [
+    (re.compile(r'\bTABLE_SCHEMA\b', re.IGNORECASE), 'table_schema'),
+    (re.compile(r'\bTABLE_NAME\b', re.IGNORECASE), 'table_name'),
+    (re.compile(r'\bCOLUMN_NAME\b', re.IGNORECASE), 'column_name'),
+]
+_IFNULL_PATTERN = re.compile(r'\bIFNULL\s*\(', re.IGNORECASE)
+_DATE_FORMAT_PATTERN = re.compile(
+    r'DATE_FORMAT\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)',
+    re.IGNORECASE
+)
+# Mots-clés déclencheurs : une requête qui n'en contient aucun est renvoyée telle quelle
+_TRIGGER_KEYWORDS = ('INFORMATION_SCHEMA', 'TABLE_SCHEMA', 'TABLE_NAME', 'COLUMN_NAME', 'IFNULL', 'DATE_FORMAT')
+
+# Conversion basique des formats courants DATE_FORMAT → TO_CHAR
+_DATE_FORMAT_MAP = {
+    '%Y-%m-%d': 'YYYY-MM-DD',
+    '%d/%m/%Y': 'DD/MM/YYYY',
+    '%Y-%m-%d %H:%i:%s': 'YYYY-MM-DD HH24:MI:SS',
+}
+
+# Cache LRU borné des requêtes traduites (clé = texte de la requête)
+TRANSLATION_CACHE_SIZE = int(os.getenv('DB_ADAPTER_CACHE_SIZE', '1024'))
+_translation_cache = OrderedDict()
+_translation_lock = threading.Lock()
+_translation_stats = {
+    'hits': 0,
+    'misses': 0,
+    'skipped_orm': 0,
+    'translated': 0,
+    'translation_time': 0.0,
+}
+
+
+def _convert_date_format(match):
+    expr = match.group(1)
+    fmt = match.group(2).strip("'\"")
+    pg_fmt = _DATE_FORMAT_MAP.get(fmt, fmt)
+    return f"TO_CHAR({expr}, '{pg_fmt}')"
+
+
+def _translate_for_postgresql(sql_query):
+    """Applique les conversions MySQL → PostgreSQL (sans cache)"""
+    upper = sql_query.upper()
+    if not any(keyword in upper for keyword in _TRIGGER_KEYWORDS):
         return sql_query
     
-    adapted = sql_query
-    
     # Conversion INFORMATION_SCHEMA.COLUMNS avec DATABASE()
     # MySQL: TABLE_SCHEMA = DATABASE()
     # PostgreSQL: table_schema = 'public'
-    pattern1 = re.compile(
-        r'INFORMATION_SCHEMA\.COLUMNS\s+WHERE\s+TABLE_SCHEMA\s*=\s*DATABASE\(\)',
-        re.IGNORECASE
-    )
-    adapted = pattern1.sub(
+    adapted = _INFORMATION_SCHEMA_PATTERN.sub(
         "information_schema.columns WHERE table_schema = 'public'",
-        adapted
+        sql_query
     )
     
     # Conversion TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME en minuscules
-    adapted = re.sub(r'\bTABLE_SCHEMA\b', 'table_schema', adapted, flags=re.IGNORECASE)
-    adapted = re.sub(r'\bTABLE_NAME\b', 'table_name', adapted, flags=re.IGNORECASE)
-    adapted = re.sub(r'\bCOLUMN_NAME\b', 'column_name', adapted, flags=re.IGNORECASE)
+    for pattern, replacement in _IDENTIFIER_PATTERNS:
+        adapted = pattern.sub(replacement, adapted)
     
     # Conversion IFNULL() → COALESCE()
-    adapted = re.sub(r'\bIFNULL\s*\(', 'COALESCE(', adapted, flags=re.IGNORECASE)
+    adapted = _IFNULL_PATTERN.sub('COALESCE(', adapted)
     
     # Conversion DATE_FORMAT() → TO_CHAR() (basique)
     # Note: Cette conversion est basique, peut nécessiter des ajustements manuels
-    date_format_pattern = re.compile(
-        r'DATE_FORMAT\s*\(\s*([^,]+)\s*,\s*([^)]+)\s*\)',
-        re.IGNORECASE
-    )
-    def convert_date_format(match):
-        expr = match.group(1)
-        fmt = match.group(2).strip("'\"")
-        # Conversion basique des formats courants
-        fmt_map = {
-            '%Y-%m-%d': 'YYYY-MM-DD',
-            '%d/%m/%Y': 'DD/MM/YYYY',
-            '%Y-%m-%d %H:%i:%s': 'YYYY-MM-DD HH24:MI:SS',
-        }
-        pg_fmt = fmt_map.get(fmt, fmt)
-        return f"TO_CHAR({expr}, '{pg_fmt}')"
-    
-    adapted = date_format_pattern.sub(convert_date_format, adapted)
-    
-    # Log si une conversion a été effectuée
+    adapted = _DATE_FORMAT_PATTERN.sub(_convert_date_format, adapted)
+    
+    return adapted
+
+
+def translate_statement(sql_query):
+    """
+    Traduit une requête MySQL pour PostgreSQL en passant par le cache LRU
+    
+    Args:
+        sql_query: Requête SQL (texte)
+    
+    Returns:
+        str: Requête SQL adaptée
+    """
+    with _translation_lock:
+        cached = _translation_cache.get(sql_query)
+        if cached is not None:
+            _translation_cache.move_to_end(sql_query)
+            _translation_stats['hits'] += 1
+            return cached
+    
+    started = time.perf_counter()
+    adapted = _translate_for_postgresql(sql_query)
+    elapsed = time.perf_counter() - started
+    
+    with _translation_lock:
+        _translation_stats['misses'] += 1
+        _translation_stats['translation_time'] += elapsed
+        if adapted != sql_query:
+            _translation_stats['translated'] += 1
+        _translation_cache[sql_query] = adapted
+        if len(_translation_cache) > TRANSLATION_CACHE_SIZE:
+            _translation_cache.popitem(last=False)
+    
     if adapted != sql_query:
         logger.debug(f"Requête SQL adaptée:\nOriginal: {sql_query}\nAdapté: {adapted}")
-    
     return adapted
 
 
+def adapt_sql_query(sql_query, db_session=None):
+    """
+    Adapte une requête SQL MySQL vers PostgreSQL si nécessaire
+    
+    Args:
+        sql_query: Requête SQL à adapter
+        db_session: Session SQLAlchemy (optionnel)
+    
+    Returns:
+        str: Requête SQL adaptée
+    """
+    if not is_postgresql(db_session):
+        return sql_query
+    return translate_statement(sql_query)
+
+
+def get_translation_stats():
+    """
+    Compteurs du traducteur de requêtes (succès/échecs du cache, temps de traduction)
+    
+    Returns:
+        dict: hits, misses, skipped_orm, translated, translation_time (secondes),
+              cache_size, cache_max_size, hit_ratio
+    """
+    with _translation_lock:
+        stats = dict(_translation_stats)
+        stats['cache_size'] = len(_translation_cache)
+    stats['cache_max_size'] = TRANSLATION_CACHE_SIZE
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    return stats
+
+
+def reset_translation_stats(clear_statements=False):
+    """Remet les compteurs à zéro (et vide le cache des requêtes si demandé)"""
+    with _translation_lock:
+        for key in _translation_stats:
+            _translation_stats[key] = 0.0 if key == 'translation_time' else 0
+        if clear_statements:
+            _translation_cache.clear()
+
+
 # =========================================================
 # MIDDLEWARE SQLALCHEMY (ADAPTATION AUTOMATIQUE)
 # =========================================================
 
+def is_orm_compiled(context):
+    """
+    Vrai si la requête a été compilée par SQLAlchemy à partir d'une construction
+    Core/ORM (select(), Query...) : le SQL est déjà produit dans le bon dialecte.
+    Seul le SQL brut (text(), exec_driver_sql) doit être traduit.
+    """
+    compiled = getattr(context, 'compiled', None) if context is not None else None
+    if compiled is None:
+        return False
+    return not isinstance(getattr(compiled, 'statement', None), TextClause)
+
+
 def setup_sqlalchemy_middleware(engine):
     """
     Configure le middleware SQLAlchemy pour adapter automatiquement les requêtes
     
+    Le dialecte est résolu une seule fois pour le moteur : hors PostgreSQL,
+    aucun listener n'est installé.
+    
     Args:
         engine: Moteur SQLAlchemy
+    
+    Returns:
+        bool: True si le listener a été installé
     """
+    if engine.dialect.name != 'postgresql':
+        return False
+    
     @listens_for(engine, "before_cursor_execute", retval=True)
     def receive_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
         """
-        Intercepte les requêtes SQL avant exécution et les adapte si nécessaire
+        Intercepte les requêtes SQL brutes avant exécution et les adapte si nécessaire
         """
-        if is_postgresql():
-            # Adapter la requête pour PostgreSQL
-            adapted_statement = adapt_sql_query(statement)
-            if adapted_statement != statement:
-                logger.debug(f"Requête adaptée automatiquement: {statement[:100]}...")
-                return adapted_statement, parameters
+        if is_orm_compiled(context):
+            with _translation_lock:
+                _translation_stats['skipped_orm'] += 1
+            return statement, parameters
+        
+        adapted_statement = translate_statement(statement)
+        if adapted_statement != statement:
+            logger.debug(f"Requête adaptée automatiquement: {statement[:100]}...")
+            return adapted_statement, parameters
         return statement, parameters
+    
+    return True
 
 
 # =========================================================
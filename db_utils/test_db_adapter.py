@@ -19,6 +19,10 @@ from db_utils.db_adapter import (
     check_table_exists,
     get_table_columns,
     adapt_sql_query,
+    translate_statement,
+    get_translation_stats,
+    reset_translation_stats,
+    is_orm_compiled,
     get_db_info
 )
 
@@ -134,6 +138,43 @@ def test_ifnull_conversion():
         print("✅ Test de conversion IFNULL réussi")
 
 
+def test_translation_cache():
+    """Test du cache LRU des requêtes traduites"""
+    print("\n=== Test du cache de traduction ===")
+    
+    reset_translation_stats(clear_statements=True)
+    query = "SELECT IFNULL(quantity, 0) FROM stock WHERE id = :id"
+    
+    first = translate_statement(query)
+    second = translate_statement(query)
+    untouched = translate_statement("SELECT id FROM users")
+    stats = get_translation_stats()
+    print(f"Compteurs: {stats}")
+    
+    assert first == second == "SELECT COALESCE(quantity, 0) FROM stock WHERE id = :id"
+    assert untouched == "SELECT id FROM users"
+    assert stats['hits'] == 1 and stats['misses'] == 2, "Une requête déjà traduite doit venir du cache"
+    assert stats['translated'] == 1
+    print("✅ Test du cache de traduction réussi")
+
+
+def test_orm_statements_skipped():
+    """Seul le SQL brut (text()) passe par le traducteur"""
+    print("\n=== Test de détection des requêtes ORM ===")
+    from types import SimpleNamespace
+    from sqlalchemy import select, text
+    from sqlalchemy.dialects import postgresql
+    from models import User
+    
+    orm_compiled = select(User.id).compile(dialect=postgresql.dialect())
+    raw_compiled = text("SELECT IFNULL(1, 0)").compile(dialect=postgresql.dialect())
+    
+    assert is_orm_compiled(SimpleNamespace(compiled=orm_compiled))
+    assert not is_orm_compiled(SimpleNamespace(compiled=raw_compiled))
+    assert not is_orm_compiled(SimpleNamespace(compiled=None)), "exec_driver_sql doit être traduit"
+    print("✅ Test de détection des requêtes ORM réussi")
+
+
 def run_all_tests():
     """Exécute tous les tests"""
     print("=" * 70)
@@ -147,6 +188,8 @@ def run_all_tests():
         test_get_table_columns()
         test_adapt_sql_query()
         test_ifnull_conversion()
+        test_translation_cache()
+        test_orm_statements_skipped()
         
         print("\n" + "=" * 70)
         print("✅ TOUS LES TESTS SONT PASSÉS")
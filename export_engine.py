@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Moteur d'export des listes (Excel / CSV) à mémoire constante
+
+Les exports (mouvements, réceptions, sorties, retours, sessions d'inventaire,
+ventes de promotion, articles) ne chargent plus tout le résultat en mémoire
+(.all() + DataFrame pandas + openpyxl) :
+
+- les lignes sont lues par lots depuis la base (yield_per, curseur serveur
+  quand le pilote le permet) ;
+- le classeur est écrit par XlsxWriter en mode constant_memory (une ligne à la
+  fois, fichier temporaire), les largeurs de colonnes et la ligne TOTAL sont
+  calculées au fil de l'eau ; ?format=csv produit un CSV envoyé au fil de la
+  lecture ;
+- la réponse est envoyée par blocs (chunked) depuis le fichier temporaire ;
+- au-delà de EXPORT_ASYNC_THRESHOLD lignes, l'export devient une tâche de fond
+  (job_queue, tâche 'exports.build') et l'utilisateur reçoit un lien de
+  téléchargement (/exports/<id>).
+
+Chaque module déclare ses exports avec @exporter(nom, ...) : la fonction reçoit
+les paramètres de la requête (MultiDict) et renvoie (requête, lignes), où
+lignes(objets) produit les lignes du fichier à partir des objets lus par lots.
+
+EXPORT_DIR doit être partagé entre le web et le worker dédié (disque commun)
+pour les exports en tâche de fond.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, UTC
+from itertools import islice
+
+from flask import (Blueprint, Response, current_app, flash, redirect, render_template,
+                   request, send_file, stream_with_context, url_for)
+from flask_login import current_user, login_required, login_user
+from werkzeug.datastructures import MultiDict
+
+from models import db, BackgroundJob, User
+import job_queue
+
+# Modules qui déclarent des exports (@exporter) : importés par les workers
+EXPORT_MODULES = ('stocks', 'inventaires', 'promotion', 'referentiels')
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_ASYNC_THRESHOLD = int(os.getenv('EXPORT_ASYNC_THRESHOLD', '20000'))
+EXPORT_DIR = os.getenv('EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'import_profit_exports'))
+EXPORT_RETENTION = int(os.getenv('EXPORT_RETENTION_SECONDS', str(24 * 3600)))
+CHUNK_SIZE = 64 * 1024
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_MIMETYPE = 'text/csv; charset=utf-8'
+
+exports_bp = Blueprint('exports', __name__, url_prefix='/exports')
+
+_exports = {}  # nom -> ExportDefinition
+_modules_loaded = False
+
+
+class ExportDefinition:
+    """Description d'un export : feuille, colonnes, totaux et fonction de construction"""
+
+    def __init__(self, name, build, sheet_name, filename, columns, totals=(), max_width=40):
+        self.name = name
+        self.build = build
+        self.sheet_name = sheet_name
+        self.filename = filename
+        self.columns = list(columns)
+        self.totals = [self.columns.index(column) for column in totals]
+        self.max_width = max_width
+
+    def make_filename(self, fmt):
+        return f'{self.filename}_{datetime.now(UTC).strftime("%Y%m%d_%H%M%S")}.{fmt}'
+
+
+def exporter(name, sheet_name, filename, columns, totals=(), max_width=40):
+    """
+    Déclare un export
+
+    Args:
+        name: identifiant ('stocks.movements')
+        sheet_name: nom de la feuille Excel
+        filename: préfixe du fichier téléchargé (suivi de l'horodatage)
+        columns: en-têtes, dans l'ordre des valeurs de chaque ligne
+        totals: colonnes sommées dans la ligne TOTAL (aucune ligne TOTAL si vide)
+        max_width: largeur maximale des colonnes Excel
+    """
+    def decorator(build):
+        _exports[name] = ExportDefinition(name, build, sheet_name, filename, columns, totals, max_width)
+        return build
+    return decorator
+
+
+def _load_export_modules():
+    global _modules_loaded
+    if _modules_loaded:
+        return
+    _modules_loaded = True
+    for module_name in EXPORT_MODULES:
+        try:
+            __import__(module_name)
+        except Exception as e:
+            print(f"⚠️ Exports: module {module_name} non chargé ({e})")
+
+
+def get_export(name):
+    if name not in _exports:
+        _load_export_modules()
+    if name not in _exports:
+        raise ValueError(f"Export inconnu: {name}")
+    return _exports[name]
+
+
+def batches(objects, size=None):
+    """Découpe un flux d'objets en listes de taille size (chargements groupés par lot)"""
+    iterator = iter(objects)
+    size = size or EXPORT_BATCH_SIZE
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def stream_query(query, batch_size=None):
+    """
+    Objets de la requête lus par lots (yield_per active aussi le curseur serveur)
+
+    MySQL : pas de curseur serveur (une connexion en streaming n'accepte pas d'autre
+    requête, or les lignes chargent leurs détails par lot) ; les objets restent
+    construits par lots.
+    """
+    query = query.yield_per(batch_size or EXPORT_BATCH_SIZE)
+    if db.session.get_bind().dialect.name == 'mysql':
+        query = query.execution_options(stream_results=False)
+    return query
+
+
+def count_rows(query):
+    """Nombre d'objets de la requête (sans tri ni chargement des relations)"""
+    return query.order_by(None).count()
+
+
+def iter_rows(definition, args):
+    """Lignes de l'export, lues par lots depuis la base"""
+    query, rows = definition.build(args)
+    return rows(stream_query(query))
+
+
+# =========================================================
+# ÉCRITURE
+# =========================================================
+
+def _cell_length(value):
+    return len(str(value)) if value is not None else 0
+
+
+def write_xlsx(definition, rows, target):
+    """
+    Écrit les lignes dans un classeur XlsxWriter en mode constant_memory
+
+    Returns:
+        int: nombre de lignes écrites (hors en-tête et TOTAL)
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(target, {'constant_memory': True, 'tmpdir': tempfile.gettempdir()})
+    try:
+        worksheet = workbook.add_worksheet(definition.sheet_name)
+        header_format = workbook.add_format({'bold': True, 'border': 1})
+        widths = [len(column) for column in definition.columns]
+        totals = {index: 0 for index in definition.totals}
+
+        worksheet.write_row(0, 0, definition.columns, header_format)
+        count = 0
+        for row in rows:
+            count += 1
+            worksheet.write_row(count, 0, row)
+            for index, value in enumerate(row):
+                widths[index] = max(widths[index], _cell_length(value))
+            for index in totals:
+                totals[index] += row[index] or 0
+
+        if count and totals:
+            total_row = ['TOTAL'] + [''] * (len(definition.columns) - 1)
+            for index, value in totals.items():
+                total_row[index] = value
+            worksheet.write_row(count + 1, 0, total_row, header_format)
+            for index, value in enumerate(total_row):
+                widths[index] = max(widths[index], _cell_length(value))
+
+        for index, width in enumerate(widths):
+            worksheet.set_column(index, index, min(width + 2, definition.max_width))
+    finally:
+        workbook.close()
+    return count
+
+
+def iter_csv(definition, rows):
+    """CSV (séparateur ';', BOM UTF-8 pour Excel) produit ligne par ligne"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data.encode('utf-8')
+
+    yield '\ufeff'.encode('utf-8')
+    writer.writerow(definition.columns)
+    for index, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if index % EXPORT_BATCH_SIZE == 0 or buffer.tell() >= CHUNK_SIZE:
+            yield flush()
+    yield flush()
+
+
+def write_csv(definition, rows, target):
+    """Écrit le CSV dans un fichier ; renvoie le nombre de lignes écrites"""
+    written = [0]
+
+    def counted():
+        for row in rows:
+            written[0] += 1
+            yield row
+
+    with open(target, 'wb') as handle:
+        for chunk in iter_csv(definition, counted()):
+            handle.write(chunk)
+    return written[0]
+
+
+def _iter_file(path, delete=True):
+    try:
+        with open(path, 'rb') as handle:
+            while True:
+                chunk = handle.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if delete:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _attachment(response, filename):
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# =========================================================
+# RÉPONSES
+# =========================================================
+
+def _export_format(args):
+    return 'csv' if (args.get('format') or '').lower() == 'csv' else 'xlsx'
+
+
+def _idempotency_key(name, args, user_id):
+    params = json.dumps(sorted(args.items(multi=True)), ensure_ascii=False)
+    digest = hashlib.sha256(f'{name}|{user_id}|{params}'.encode('utf-8')).hexdigest()[:32]
+    return f'export:{digest}:{datetime.now(UTC).strftime("%Y%m%d%H%M")}'
+
+
+def export_response(name, args=None):
+    """
+    Réponse HTTP d'un export : fichier envoyé par blocs, ou tâche de fond si volumineux
+
+    Les erreurs de construction (requête, écriture) remontent à l'appelant, qui
+    garde son flash + redirection habituels.
+    """
+    definition = get_export(name)
+    args = MultiDict(args if args is not None else request.args)
+    fmt = _export_format(args)
+
+    query, rows = definition.build(args)
+    if EXPORT_ASYNC_THRESHOLD and count_rows(query) > EXPORT_ASYNC_THRESHOLD:
+        job_id = job_queue.enqueue('exports.build',
+                                   {'export': name, 'args': list(args.items(multi=True)),
+                                    'user_id': current_user.id, 'format': fmt},
+                                   idempotency_key=_idempotency_key(name, args, current_user.id),
+                                   max_attempts=2)
+        db.session.commit()
+        flash("Export volumineux : le fichier est en cours de préparation, "
+              "il sera téléchargeable depuis le lien de cette page.", 'info')
+        return redirect(url_for('exports.download', job_id=job_id))
+
+    filename = definition.make_filename(fmt)
+    if fmt == 'csv':
+        response = Response(stream_with_context(iter_csv(definition, rows(stream_query(query)))),
+                            mimetype=CSV_MIMETYPE)
+        return _attachment(response, filename)
+
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    try:
+        write_xlsx(definition, rows(stream_query(query)), path)
+    except Exception:
+        os.remove(path)
+        raise
+    response = Response(_iter_file(path), mimetype=XLSX_MIMETYPE)
+    response.headers['Content-Length'] = str(os.path.getsize(path))
+    return _attachment(response, filename)
+
+
+# =========================================================
+# EXPORTS EN TÂCHE DE FOND
+# =========================================================
+
+def _purge_old_exports():
+    """Supprime les fichiers d'export plus anciens que EXPORT_RETENTION"""
+    limit = time.time() - EXPORT_RETENTION
+    try:
+        for entry in os.scandir(EXPORT_DIR):
+            if entry.is_file() and entry.stat().st_mtime < limit:
+                os.remove(entry.path)
+    except OSError:
+        pass
+
+
+@job_queue.task('exports.build', queue='exports', max_attempts=2)
+def build_export(export, args, user_id, format='xlsx'):
+    """Construit un export volumineux dans EXPORT_DIR pour le compte de user_id"""
+    definition = get_export(export)
+    app = current_app._get_current_object()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    _purge_old_exports()
+
+    filename = definition.make_filename(format)
+    stored = f'{hashlib.sha256(f"{export}{user_id}{time.time()}".encode()).hexdigest()[:16]}_{filename}'
+    path = os.path.join(EXPORT_DIR, stored)
+    started = time.perf_counter()
+
+    # Contexte neuf (g, session) et utilisateur connecté : mêmes filtres de rôle et de région que la requête
+    with app.app_context(), app.test_request_context():
+        user = db.session.get(User, user_id)
+        if user is None or not user.is_active:
+            raise job_queue.PermanentJobError(f"Utilisateur {user_id} introuvable ou inactif")
+        login_user(user)
+        rows = iter_rows(definition, MultiDict(args))
+        count = write_csv(definition, rows, path) if format == 'csv' else write_xlsx(definition, rows, path)
+
+    print(f"✅ Export {export} ({count} lignes) prêt en {time.perf_counter() - started:.1f}s: {stored}")
+    return {'file': stored, 'filename': filename, 'rows': count, 'user_id': user_id, 'format': format}
+
+
+def _export_job(job_id):
+    """Tâche d'export de l'utilisateur connecté (None sinon)"""
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or job.task != 'exports.build' or (job.payload or {}).get('user_id') != current_user.id:
+        return None
+    return job
+
+
+@exports_bp.route('/<int:job_id>')
+@login_required
+def download(job_id):
+    """Page d'attente puis téléchargement d'un export préparé en tâche de fond"""
+    job = _export_job(job_id)
+    if job is None:
+        flash("Export introuvable.", 'error')
+        return redirect(url_for('index'))
+
+    result = job.result or {}
+    path = os.path.join(EXPORT_DIR, os.path.basename(result.get('file') or ''))
+    if job.status == 'succeeded' and result.get('file') and os.path.isfile(path):
+        mimetype = CSV_MIMETYPE if result.get('format') == 'csv' else XLSX_MIMETYPE
+        return send_file(path, mimetype=mimetype, as_attachment=True, download_name=result['filename'])
+
+    if job.status == 'succeeded':
+        flash("Le fichier d'export a expiré, relancez l'export.", 'warning')
+    elif job.status == 'dead':
+        flash(f"L'export a échoué : {job.last_error or 'erreur inconnue'}", 'error')
+    return render_template('exports/download.html', job=job,
+                           definition=_exports.get((job.payload or {}).get('export')))
@@ -16,7 +16,6 @@ def envoyer_rappels_vehicules():
     """Envoie les rappels pour les documents véhicules expirant bientôt"""
     try:
         from models import Vehicle, VehicleDocument, User
-        from notifications_automatiques import notifications_automatiques
         
         # Récupérer tous les véhicules actifs
         vehicles = Vehicle.query.filter_by(status='active').all()
@@ -47,19 +46,24 @@ def envoyer_rappels_vehicules():
                     'documents': documents_expiring
                 })
         
-        # Envoyer les notifications
+        # Mettre les notifications en file (une tâche par véhicule et par jour : un
+        # second déclenchement le même jour ne renvoie pas le rappel)
+        import job_queue
+        from models import db
+        day = date.today().strftime('%Y%m%d')
         for item in vehicles_a_notifier:
-            try:
-                notifications_automatiques.notifier_rappel_visage_vehicule(
-                    item['vehicle'],
-                    days_until_expiry=15
-                )
-            except Exception as e:
-                logger.error(f"Erreur lors de la notification pour véhicule {item['vehicle'].id}: {e}")
+            job_queue.enqueue(
+                'notifications.rappel_vehicule',
+                {'vehicle_id': item['vehicle'].id, 'days_until_expiry': 15},
+                idempotency_key=f"rappel_vehicule:{item['vehicle'].id}:{day}"
+            )
+        db.session.commit()
         
         return len(vehicles_a_notifier)
         
     except Exception as e:
+        from models import db
+        db.session.rollback()
         logger.error(f"Erreur lors de l'envoi des rappels véhicules: {e}")
         import traceback
         traceback.print_exc()
@@ -2,6 +2,13 @@
 # -*- coding: utf-8 -*-
 """
 Module de synchronisation entre les commandes validées et les prévisions de ventes
+
+Les réalisations sont calculées de façon ensembliste : une seule jointure
+agrégée CommercialOrderItem → CommercialOrderClient → CommercialOrder donne la
+quantité et la valeur réalisées par (prévision, article), puis les résultats
+sont écrits par mises à jour groupées.
+- recalculate_all_forecasts_from_orders : recalcul complet (remise à zéro + agrégat)
+- update_forecasts_from_order : mode incrémental, applique le delta d'une commande validée
 """
 
 from decimal import Decimal
@@ -10,101 +17,124 @@ from models import (
     db, CommercialOrder, CommercialOrderClient, CommercialOrderItem,
     Forecast, ForecastItem, StockItem
 )
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, bindparam, case, func, select, update
+
+
+def _realization_query(*conditions, positive_only=True):
+    """
+    Jointure agrégée des lignes de commandes validées sur les articles des prévisions
+
+    Une ligne compte pour une prévision si la commande est validée, le client
+    n'est pas rejeté, l'article correspond et la date de commande tombe dans
+    la période de la prévision.
+
+    Returns:
+        Select: (forecast_item_id, forecast_id, forecast_quantity,
+                 realized_quantity, realized_value, lines_count) par article de prévision
+    """
+    line_value = CommercialOrderItem.quantity * func.coalesce(CommercialOrderItem.unit_price_gnf, 0)
+    order_day = func.date(CommercialOrder.order_date)
+    query = select(
+        ForecastItem.id.label('forecast_item_id'),
+        ForecastItem.forecast_id.label('forecast_id'),
+        ForecastItem.forecast_quantity.label('forecast_quantity'),
+        func.sum(CommercialOrderItem.quantity).label('realized_quantity'),
+        func.sum(line_value).label('realized_value'),
+        func.count(CommercialOrderItem.id).label('lines_count')
+    ).select_from(ForecastItem)\
+     .join(Forecast, Forecast.id == ForecastItem.forecast_id)\
+     .join(CommercialOrderItem, CommercialOrderItem.stock_item_id == ForecastItem.stock_item_id)\
+     .join(CommercialOrderClient, CommercialOrderClient.id == CommercialOrderItem.order_client_id)\
+     .join(CommercialOrder, CommercialOrder.id == CommercialOrderClient.order_id)\
+     .where(
+        CommercialOrder.status == 'validated',
+        CommercialOrderClient.status != 'rejected',
+        order_day >= Forecast.start_date,
+        order_day <= Forecast.end_date,
+        *conditions
+     ).group_by(ForecastItem.id, ForecastItem.forecast_id, ForecastItem.forecast_quantity)
+    if positive_only:
+        query = query.where(CommercialOrderItem.quantity > 0)
+    return query
+
+
+def _percentage(realized_quantity, forecast_quantity):
+    if forecast_quantity and forecast_quantity > 0:
+        return (Decimal(str(realized_quantity)) / Decimal(str(forecast_quantity))) * 100
+    return Decimal('0')
+
+
+def _refresh_forecast_totals(forecast_ids=None):
+    """Recalcule total_realized_value des prévisions actives en une instruction (sous-requête corrélée)"""
+    items_total = select(func.coalesce(func.sum(ForecastItem.realized_value_gnf), 0))\
+        .where(ForecastItem.forecast_id == Forecast.id).scalar_subquery()
+    statement = update(Forecast).where(Forecast.status == 'active').values(total_realized_value=items_total)
+    if forecast_ids is not None:
+        statement = statement.where(Forecast.id.in_(forecast_ids))
+    db.session.execute(statement.execution_options(synchronize_session=False))
+
+
+def _forecasts_summary(forecast_ids):
+    rows = db.session.execute(
+        select(Forecast.id, Forecast.name, Forecast.total_realized_value)
+        .where(Forecast.id.in_(forecast_ids)).order_by(Forecast.id)
+    ).all()
+    return [{'id': row.id, 'name': row.name, 'total_realized': float(row.total_realized_value or 0)}
+            for row in rows]
 
 
 def update_forecasts_from_order(order):
     """
-    Met à jour les prévisions de ventes basées sur une commande validée
-    
+    Met à jour les prévisions de ventes basées sur une commande validée (mode incrémental)
+
+    Seul le delta de la commande est appliqué : quantités et valeurs sont
+    ajoutées aux réalisations existantes par des mises à jour groupées.
+
     Args:
         order: CommercialOrder validée
-        
+
     Returns:
         dict: Statistiques de mise à jour
     """
     if order.status != 'validated':
         return {'updated': 0, 'forecasts': [], 'message': 'Commande non validée'}
-    
-    # Convertir order_date en date si c'est un datetime
-    order_date = order.order_date
-    if isinstance(order_date, datetime):
-        order_date = order_date.date()
-    
-    # Trouver toutes les prévisions actives qui couvrent la date de la commande
-    active_forecasts = Forecast.query.filter(
-        and_(
-            Forecast.status == 'active',
-            Forecast.start_date <= order_date,
-            Forecast.end_date >= order_date
-        )
+
+    db.session.flush()
+    deltas = db.session.execute(
+        _realization_query(CommercialOrder.id == order.id, Forecast.status == 'active')
     ).all()
-    
-    if not active_forecasts:
+
+    if not deltas:
         return {'updated': 0, 'forecasts': [], 'message': 'Aucune prévision active trouvée pour cette date'}
-    
-    updated_forecasts = []
-    total_items_updated = 0
-    
-    # Pour chaque prévision active
-    for forecast in active_forecasts:
-        forecast_updated = False
-        forecast_total_realized = Decimal('0')
-        
-        # Pour chaque client de la commande (non rejeté)
-        for client in order.clients:
-            if client.status == 'rejected':
-                continue
-                
-            # Pour chaque article de la commande
-            for order_item in client.items:
-                if not order_item.quantity or order_item.quantity <= 0:
-                    continue
-                
-                # Trouver le ForecastItem correspondant (même StockItem)
-                forecast_item = ForecastItem.query.filter_by(
-                    forecast_id=forecast.id,
-                    stock_item_id=order_item.stock_item_id
-                ).first()
-                
-                if forecast_item:
-                    # Mettre à jour les réalisations
-                    # Ajouter la quantité et la valeur (pas remplacer, car il peut y avoir plusieurs commandes)
-                    forecast_item.realized_quantity += order_item.quantity
-                    
-                    # Calculer la valeur réalisée
-                    item_value = order_item.quantity * (order_item.unit_price_gnf or Decimal('0'))
-                    forecast_item.realized_value_gnf += item_value
-                    
-                    # Recalculer le pourcentage de réalisation
-                    if forecast_item.forecast_quantity > 0:
-                        forecast_item.realization_percentage = (
-                            (forecast_item.realized_quantity / forecast_item.forecast_quantity) * 100
-                        )
-                    
-                    forecast_total_realized += item_value
-                    forecast_updated = True
-                    total_items_updated += 1
-        
-        # Mettre à jour le total réalisé de la prévision
-        if forecast_updated:
-            # Recalculer le total depuis tous les items
-            forecast.total_realized_value = Decimal('0')
-            for item in forecast.items:
-                forecast.total_realized_value += item.realized_value_gnf
-            
-            updated_forecasts.append({
-                'id': forecast.id,
-                'name': forecast.name,
-                'total_realized': float(forecast.total_realized_value)
-            })
-    
-    if updated_forecasts:
-        db.session.commit()
-    
+
+    # Incréments appliqués côté base (pas de lecture-modification-écriture en Python)
+    items_table = ForecastItem.__table__
+    new_quantity = items_table.c.realized_quantity + bindparam('delta_quantity')
+    db.session.execute(
+        update(items_table)
+        .where(items_table.c.id == bindparam('item_id'))
+        .values(
+            realized_quantity=new_quantity,
+            realized_value_gnf=items_table.c.realized_value_gnf + bindparam('delta_value'),
+            realization_percentage=case(
+                (items_table.c.forecast_quantity > 0, new_quantity * 100 / items_table.c.forecast_quantity),
+                else_=items_table.c.realization_percentage
+            )
+        ),
+        [{'item_id': row.forecast_item_id,
+          'delta_quantity': row.realized_quantity,
+          'delta_value': row.realized_value} for row in deltas]
+    )
+
+    forecast_ids = sorted({row.forecast_id for row in deltas})
+    _refresh_forecast_totals(forecast_ids)
+    db.session.commit()
+    db.session.expire_all()
+
+    updated_forecasts = _forecasts_summary(forecast_ids)
     return {
         'updated': len(updated_forecasts),
-        'items_updated': total_items_updated,
+        'items_updated': sum(row.lines_count for row in deltas),
         'forecasts': updated_forecasts,
         'message': f'{len(updated_forecasts)} prévision(s) mise(s) à jour'
     }
@@ -113,125 +143,120 @@ def update_forecasts_from_order(order):
 def recalculate_all_forecasts_from_orders(start_date=None, end_date=None):
     """
     Recalcule toutes les prévisions basées sur les commandes validées
-    
+
+    Remise à zéro et agrégat en quelques instructions, dans une transaction courte.
+
     Args:
         start_date: Date de début (optionnel)
         end_date: Date de fin (optionnel)
-        
+
     Returns:
         dict: Statistiques de recalcul
     """
-    # Réinitialiser toutes les réalisations
-    forecast_items = ForecastItem.query.join(Forecast).filter(
-        Forecast.status == 'active'
-    ).all()
-    
-    for item in forecast_items:
-        item.realized_quantity = Decimal('0')
-        item.realized_value_gnf = Decimal('0')
-        item.realization_percentage = Decimal('0')
-    
-    # Récupérer toutes les commandes validées dans la période
-    query = CommercialOrder.query.filter(
-        CommercialOrder.status == 'validated'
+    active_forecast_ids = select(Forecast.id).where(Forecast.status == 'active')
+
+    # Réinitialiser toutes les réalisations (une instruction)
+    db.session.execute(
+        update(ForecastItem)
+        .where(ForecastItem.forecast_id.in_(active_forecast_ids))
+        .values(realized_quantity=0, realized_value_gnf=0, realization_percentage=0)
+        .execution_options(synchronize_session=False)
     )
-    
+
+    # Commandes validées dans la période
+    order_conditions = []
     if start_date:
-        query = query.filter(CommercialOrder.order_date >= start_date)
+        order_conditions.append(CommercialOrder.order_date >= start_date)
     if end_date:
-        query = query.filter(CommercialOrder.order_date <= end_date)
-    
-    validated_orders = query.all()
-    
-    updated_forecasts = set()
-    total_items_updated = 0
-    
-    # Traiter chaque commande
-    for order in validated_orders:
-        result = update_forecasts_from_order(order)
-        if result['updated'] > 0:
-            for forecast_info in result['forecasts']:
-                updated_forecasts.add(forecast_info['id'])
-            total_items_updated += result['items_updated']
-    
-    # Recalculer les totaux de toutes les prévisions mises à jour
-    for forecast_id in updated_forecasts:
-        forecast = Forecast.query.get(forecast_id)
-        if forecast:
-            forecast.total_realized_value = Decimal('0')
-            for item in forecast.items:
-                forecast.total_realized_value += item.realized_value_gnf
-    
+        order_conditions.append(CommercialOrder.order_date <= end_date)
+
+    orders_processed = db.session.execute(
+        select(func.count(CommercialOrder.id)).where(CommercialOrder.status == 'validated', *order_conditions)
+    ).scalar() or 0
+
+    realizations = db.session.execute(
+        _realization_query(Forecast.status == 'active', *order_conditions)
+    ).all()
+
+    # Écriture groupée par clé primaire
+    if realizations:
+        db.session.execute(update(ForecastItem), [
+            {
+                'id': row.forecast_item_id,
+                'realized_quantity': row.realized_quantity,
+                'realized_value_gnf': row.realized_value,
+                'realization_percentage': _percentage(row.realized_quantity, row.forecast_quantity)
+            }
+            for row in realizations
+        ])
+
+    # Totaux de toutes les prévisions actives (y compris celles revenues à zéro)
+    _refresh_forecast_totals()
     db.session.commit()
-    
+    db.session.expire_all()
+
+    updated_forecasts = {row.forecast_id for row in realizations}
     return {
-        'orders_processed': len(validated_orders),
+        'orders_processed': orders_processed,
         'forecasts_updated': len(updated_forecasts),
-        'items_updated': total_items_updated,
-        'message': f'{len(validated_orders)} commande(s) traitée(s), {len(updated_forecasts)} prévision(s) mise(s) à jour'
+        'items_updated': sum(row.lines_count for row in realizations),
+        'message': f'{orders_processed} commande(s) traitée(s), {len(updated_forecasts)} prévision(s) mise(s) à jour'
     }
 
 
 def get_forecast_realization_from_orders(forecast_id):
     """
     Calcule les réalisations d'une prévision spécifique basées sur les commandes validées
-    
+
     Args:
         forecast_id: ID de la prévision
-        
+
     Returns:
         dict: Détails des réalisations
     """
     forecast = Forecast.query.get_or_404(forecast_id)
-    
-    # Récupérer toutes les commandes validées dans la période de la prévision
-    validated_orders = CommercialOrder.query.filter(
-        and_(
+
+    # Nombre de commandes validées dans la période de la prévision
+    orders_count = db.session.execute(
+        select(func.count(CommercialOrder.id)).where(
             CommercialOrder.status == 'validated',
             CommercialOrder.order_date >= forecast.start_date,
             CommercialOrder.order_date <= forecast.end_date
         )
-    ).all()
-    
+    ).scalar() or 0
+
+    realizations = {
+        row.forecast_item_id: row
+        for row in db.session.execute(
+            _realization_query(ForecastItem.forecast_id == forecast.id, positive_only=False)
+        ).all()
+    }
+
     items_realization = {}
     total_realized_value = Decimal('0')
-    
-    # Pour chaque article de la prévision
+
     for forecast_item in forecast.items:
-        item_realized_qty = Decimal('0')
-        item_realized_value = Decimal('0')
-        orders_count = 0
-        
-        # Parcourir toutes les commandes validées
-        for order in validated_orders:
-            for client in order.clients:
-                if client.status == 'rejected':
-                    continue
-                
-                for order_item in client.items:
-                    if order_item.stock_item_id == forecast_item.stock_item_id:
-                        item_realized_qty += order_item.quantity
-                        item_realized_value += order_item.quantity * (order_item.unit_price_gnf or Decimal('0'))
-                        orders_count += 1
-        
+        row = realizations.get(forecast_item.id)
+        item_realized_qty = Decimal(str(row.realized_quantity)) if row else Decimal('0')
+        item_realized_value = Decimal(str(row.realized_value)) if row else Decimal('0')
+
         items_realization[forecast_item.id] = {
             'stock_item_id': forecast_item.stock_item_id,
             'stock_item_name': forecast_item.stock_item.name if forecast_item.stock_item else 'N/A',
             'forecast_quantity': float(forecast_item.forecast_quantity),
             'realized_quantity': float(item_realized_qty),
             'realized_value': float(item_realized_value),
-            'orders_count': orders_count
+            'orders_count': row.lines_count if row else 0
         }
-        
+
         total_realized_value += item_realized_value
-    
+
     return {
         'forecast_id': forecast_id,
         'forecast_name': forecast.name,
         'start_date': forecast.start_date.isoformat(),
         'end_date': forecast.end_date.isoformat(),
-        'orders_count': len(validated_orders),
+        'orders_count': orders_count,
         'total_realized_value': float(total_realized_value),
         'items': items_realization
     }
-
@@ -1,8 +1,32 @@
 # Configuration Gunicorn pour Render
 # Optimisée pour les connexions SSE (Server-Sent Events)
 
+import os
+
+# Profil de workers (variable GUNICORN_WORKER_CLASS) :
+# - 'gevent'  : workers coopératifs, chaque flux SSE ne coûte qu'une greenlet (défaut)
+# - 'gthread' : un thread par connexion, sans dépendance supplémentaire
+# - 'sync'    : ancien comportement, chaque flux SSE bloque un worker entier
+worker_profile = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+
+if worker_profile == 'gevent':
+    try:
+        # Patcher avant le chargement de l'application (preload_app) pour que
+        # sockets, verrous et files du bus d'événements chat soient coopératifs
+        from gevent import monkey
+        monkey.patch_all()
+        try:
+            # psycopg2 est une extension C : sans ce hook une requête PostgreSQL bloque tout le worker
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            print("⚠️ psycogreen non installé : les requêtes PostgreSQL ne cèdent pas la main sous gevent")
+    except ImportError:
+        print("⚠️ gevent non installé, repli sur le profil gthread")
+        worker_profile = 'gthread'
+
 # Nombre de workers
-workers = 2
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
 
 # Timeout augmenté pour les connexions SSE (5 minutes)
 # Les connexions SSE peuvent rester ouvertes longtemps
@@ -11,8 +35,15 @@ timeout = 300
 # Keep-alive pour les connexions longues
 keepalive = 65
 
-# Worker class - utiliser sync pour compatibilité maximale
-worker_class = 'sync'
+# Worker class
+worker_class = worker_profile
+
+if worker_profile == 'gevent':
+    # Connexions simultanées par worker (flux SSE + pages)
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+elif worker_profile == 'gthread':
+    # Chaque flux SSE occupe un thread : dimensionner au-delà du nombre d'onglets ouverts
+    threads = int(os.getenv('GUNICORN_THREADS', '32'))
 
 # Max requests - recycler les workers après N requêtes pour éviter les fuites mémoire
 max_requests = 1000
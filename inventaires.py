@@ -18,6 +18,8 @@ from sqlalchemy import or_, func, extract
 from auth import has_permission
 from utils import parse_pile_dimensions
 from sqlalchemy.orm import joinedload
+import inventory_validation
+import export_engine
 
 # Créer le blueprint
 inventaires_bp = Blueprint('inventaires', __name__, url_prefix='/inventory')
@@ -374,8 +376,12 @@ def session_detail(id):
     # Calculer le pourcentage de précision
     precision_pct = (zero_count / total_items * 100) if total_items > 0 else 0
     
+    # Validation en arrière-plan éventuelle (grosses sessions)
+    validation_job = inventory_validation.latest_job(id) if session.status != 'validated' else None
+    
     return render_template('inventaires/session_detail.html', 
                          session=session,
+                         validation_job=inventory_validation.job_progress(validation_job),
                          details=details,
                          details_with_value=details_with_value,
                          pagination=pagination,
@@ -542,69 +548,40 @@ def session_validate(id):
         flash('Vous n\'avez pas la permission de valider cette session', 'error')
         return redirect(url_for('inventaires.session_detail', id=id))
     
-    session = InventorySession.query.options(
-        joinedload(InventorySession.details).joinedload(InventoryDetail.stock_item)
-    ).get_or_404(id)
+    session = InventorySession.query.get_or_404(id)
     
     if session.status == 'validated':
         flash('Cette session est déjà validée', 'error')
         return redirect(url_for('inventaires.session_detail', id=id))
     
-    if not session.details:
+    lines_count = inventory_validation.count_lines(id)
+    if not lines_count:
         flash('Aucun détail d\'inventaire à valider', 'error')
         return redirect(url_for('inventaires.session_detail', id=id))
     
+    # Grosse session : validation hors requête HTTP, avancement via validation-status
+    if lines_count > inventory_validation.BACKGROUND_THRESHOLD:
+        try:
+            inventory_validation.start_validation(id, requested_by_id=current_user.id)
+            flash(f'Validation de {lines_count} ligne(s) lancée en arrière-plan. '
+                  f'La session passera à l\'état validé une fois les ajustements écrits.', 'info')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Erreur lors du lancement de la validation: {str(e)}', 'error')
+        return redirect(url_for('inventaires.session_detail', id=id))
+    
     try:
-        # Générer les ajustements pour chaque écart
-        movements_created = 0
-        for detail in session.details:
-            if detail.variance != 0:
-                # Récupérer ou créer le stock du dépôt
-                depot_stock = DepotStock.query.filter_by(
-                    depot_id=session.depot_id,
-                    stock_item_id=detail.stock_item_id
-                ).first()
-                
-                if not depot_stock:
-                    depot_stock = DepotStock(
-                        depot_id=session.depot_id,
-                        stock_item_id=detail.stock_item_id,
-                        quantity=Decimal('0')
-                    )
-                    db.session.add(depot_stock)
-                
-                # Calculer la quantité d'ajustement nécessaire
-                # La variance = système - compté
-                # Pour ajuster : nouveau_stock = compté
-                # Donc ajustement = compté - système = -variance
-                adjustment_quantity = detail.counted_quantity - depot_stock.quantity
-                
-                # Créer un mouvement d'ajustement avec la quantité d'ajustement
-                movement = StockMovement(
-                    movement_type='adjustment',  # Utiliser 'adjustment' au lieu de 'inventory'
-                    stock_item_id=detail.stock_item_id,
-                    quantity=adjustment_quantity,  # Quantité d'ajustement (peut être positive ou négative)
-                    user_id=current_user.id,
-                    to_depot_id=session.depot_id,
-                    reason=f"Inventaire session {session.id}: {detail.reason or 'Ajustement suite inventaire'}",
-                    inventory_session_id=session.id
-                )
-                db.session.add(movement)
-                movements_created += 1
-                
-                # Mettre à jour le stock avec la quantité comptée
-                depot_stock.quantity = detail.counted_quantity
-        
-        # Marquer la session comme validée
-        session.status = 'validated'
-        session.validated_at = datetime.now(UTC)
-        session.validated_by_id = current_user.id
-        
+        # Générer les ajustements pour chaque écart (nombre de requêtes constant)
+        movements_created = inventory_validation.validate_session(id, current_user.id)
         db.session.commit()
         
         flash(f'Session d\'inventaire validée avec succès. {movements_created} ajustement(s) généré(s).', 'success')
         return redirect(url_for('inventaires.session_detail', id=id))
         
+    except inventory_validation.InventoryValidationError as e:
+        db.session.rollback()
+        flash(str(e), 'error')
+        return redirect(url_for('inventaires.session_detail', id=id))
     except Exception as e:
         db.session.rollback()
         import traceback
@@ -612,6 +589,18 @@ def session_validate(id):
         flash(f'Erreur lors de la validation: {str(e)}', 'error')
         return redirect(url_for('inventaires.session_detail', id=id))
 
+@inventaires_bp.route('/sessions/<int:id>/validation-status')
+@login_required
+def session_validation_status(id):
+    """Avancement de la validation en arrière-plan d'une session (JSON)"""
+    if not has_permission(current_user, 'inventory.read'):
+        return jsonify({'error': 'Accès refusé'}), 403
+    session = InventorySession.query.get_or_404(id)
+    return jsonify({
+        'session_status': session.status,
+        'job': inventory_validation.job_progress(inventory_validation.latest_job(id))
+    })
+
 @inventaires_bp.route('/sessions/<int:id>/complete', methods=['POST'])
 @login_required
 def session_complete(id):
@@ -765,141 +754,106 @@ def session_export_excel(id):
         flash(f'Erreur lors de l\'export Excel: {str(e)}', 'error')
         return redirect(url_for('inventaires.session_detail', id=id))
 
+SESSION_EXPORT_COLUMNS = ['ID', 'Date', 'Dépôt', 'Opérateur', 'Statut', 'Articles', 'Écart Total',
+                          'Valeur Écart (GNF)', 'Validé par', 'Date Validation', 'Notes']
+
+
+@export_engine.exporter('inventaires.sessions', sheet_name='Sessions Inventaire', filename='sessions_inventaire',
+                        columns=SESSION_EXPORT_COLUMNS, totals=['Articles', 'Écart Total', 'Valeur Écart (GNF)'])
+def _export_sessions(args):
+    """Requête et lignes de l'export des sessions d'inventaire (mêmes filtres que sessions_list)"""
+    search = args.get('search', '').strip()
+    status_filter = args.get('status', '')
+    depot_id = args.get('depot_id', type=int)
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    year_filter = args.get('year', type=int)
+    
+    # Construire la requête avec optimisation N+1
+    query = InventorySession.query.options(
+        joinedload(InventorySession.depot),
+        joinedload(InventorySession.operator),
+        joinedload(InventorySession.validator)
+    )
+    
+    # Appliquer les filtres (même logique que sessions_list)
+    if search:
+        query = query.join(Depot).outerjoin(User, InventorySession.operator_id == User.id).filter(
+            or_(
+                Depot.name.like(f'%{search}%'),
+                User.username.like(f'%{search}%')
+            )
+        )
+    
+    if status_filter:
+        query = query.filter(InventorySession.status == status_filter)
+    
+    if depot_id:
+        query = query.filter(InventorySession.depot_id == depot_id)
+    
+    # Filtre par année (prioritaire sur date_from/date_to si spécifié)
+    if year_filter:
+        query = query.filter(
+            extract('year', InventorySession.session_date) == year_filter
+        )
+    else:
+        # Appliquer les filtres de date seulement si pas de filtre année
+        if date_from:
+            try:
+                date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
+                query = query.filter(InventorySession.session_date >= date_from_obj)
+            except ValueError:
+                pass
+        
+        if date_to:
+            try:
+                date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+                query = query.filter(InventorySession.session_date < date_to_obj)
+            except ValueError:
+                pass
+    
+    def rows(sessions):
+        for batch in export_engine.batches(sessions):
+            # Totaux des détails agrégés en SQL, une requête par lot de sessions
+            totals = {
+                session_id: (count, variance, value)
+                for session_id, count, variance, value in db.session.query(
+                    InventoryDetail.session_id,
+                    func.count(InventoryDetail.id),
+                    func.sum(InventoryDetail.variance),
+                    func.sum(InventoryDetail.variance * StockItem.purchase_price_gnf)
+                ).outerjoin(StockItem, InventoryDetail.stock_item_id == StockItem.id)
+                .filter(InventoryDetail.session_id.in_([session.id for session in batch]))
+                .group_by(InventoryDetail.session_id)
+            }
+            for session in batch:
+                details_count, total_variances, total_value_variances = totals.get(session.id, (0, 0, 0))
+                yield [
+                    session.id,
+                    session.session_date.strftime('%d/%m/%Y %H:%M') if session.session_date else '',
+                    session.depot.name if session.depot else '',
+                    session.operator.username if session.operator else '',
+                    session.status.replace('_', ' ').title(),
+                    details_count,
+                    float(total_variances or 0),
+                    float(total_value_variances or 0),
+                    session.validator.username if session.validator else '',
+                    session.validated_at.strftime('%d/%m/%Y %H:%M') if session.validated_at else '',
+                    session.notes or ''
+                ]
+    
+    return query.order_by(InventorySession.session_date.desc(), InventorySession.id.desc()), rows
+
 @inventaires_bp.route('/sessions/export/excel')
 @login_required
 def sessions_export_excel():
-    """Export Excel de la liste des sessions d'inventaire avec filtres appliqués"""
+    """Export Excel (ou CSV avec format=csv) de la liste des sessions d'inventaire avec filtres appliqués"""
     if not has_permission(current_user, 'inventory.read'):
         flash('Vous n\'avez pas la permission d\'exporter les données', 'error')
         return redirect(url_for('inventaires.sessions_list'))
     
     try:
-        import pandas as pd
-        
-        # Récupérer les mêmes filtres que sessions_list
-        search = request.args.get('search', '').strip()
-        status_filter = request.args.get('status', '')
-        depot_id = request.args.get('depot_id', type=int)
-        date_from = request.args.get('date_from', '')
-        date_to = request.args.get('date_to', '')
-        year_filter = request.args.get('year', type=int)
-        
-        # Construire la requête avec optimisation N+1
-        query = InventorySession.query.options(
-            joinedload(InventorySession.depot),
-            joinedload(InventorySession.operator),
-            joinedload(InventorySession.validator)
-        )
-        
-        # Appliquer les filtres (même logique que sessions_list)
-        if search:
-            query = query.join(Depot).outerjoin(User, InventorySession.operator_id == User.id).filter(
-                or_(
-                    Depot.name.like(f'%{search}%'),
-                    User.username.like(f'%{search}%')
-                )
-            )
-        
-        if status_filter:
-            query = query.filter(InventorySession.status == status_filter)
-        
-        if depot_id:
-            query = query.filter(InventorySession.depot_id == depot_id)
-        
-        # Filtre par année (prioritaire sur date_from/date_to si spécifié)
-        if year_filter:
-            query = query.filter(
-                extract('year', InventorySession.session_date) == year_filter
-            )
-        else:
-            # Appliquer les filtres de date seulement si pas de filtre année
-            if date_from:
-                try:
-                    date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-                    query = query.filter(InventorySession.session_date >= date_from_obj)
-                except ValueError:
-                    pass
-            
-            if date_to:
-                try:
-                    date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
-                    query = query.filter(InventorySession.session_date < date_to_obj)
-                except ValueError:
-                    pass
-        
-        # Récupérer toutes les sessions (sans pagination pour l'export)
-        sessions = query.order_by(InventorySession.session_date.desc()).all()
-        
-        # Préparer les données
-        data = []
-        for session in sessions:
-            # Compter les détails
-            details_count = len(session.details) if session.details else 0
-            
-            # Calculer les totaux des écarts
-            total_variances = sum(float(d.variance) for d in session.details) if session.details else 0
-            total_value_variances = sum(
-                float(d.variance * getattr(d.stock_item, 'purchase_price_gnf', 0)) 
-                for d in session.details 
-                if d.stock_item
-            ) if session.details else 0
-            
-            data.append({
-                'ID': session.id,
-                'Date': session.session_date.strftime('%d/%m/%Y %H:%M') if session.session_date else '',
-                'Dépôt': session.depot.name if session.depot else '',
-                'Opérateur': session.operator.username if session.operator else '',
-                'Statut': session.status.replace('_', ' ').title(),
-                'Articles': details_count,
-                'Écart Total': total_variances,
-                'Valeur Écart (GNF)': total_value_variances,
-                'Validé par': session.validator.username if session.validator else '',
-                'Date Validation': session.validated_at.strftime('%d/%m/%Y %H:%M') if session.validated_at else '',
-                'Notes': session.notes or ''
-            })
-        
-        # Créer le DataFrame
-        df = pd.DataFrame(data)
-        
-        # Ajouter une ligne de totaux
-        if len(df) > 0:
-            total_row = pd.DataFrame([{
-                'ID': 'TOTAL',
-                'Date': '',
-                'Dépôt': '',
-                'Opérateur': '',
-                'Statut': '',
-                'Articles': df['Articles'].sum(),
-                'Écart Total': df['Écart Total'].sum(),
-                'Valeur Écart (GNF)': df['Valeur Écart (GNF)'].sum(),
-                'Validé par': '',
-                'Date Validation': '',
-                'Notes': ''
-            }])
-            df = pd.concat([df, total_row], ignore_index=True)
-        
-        # Créer le fichier Excel
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Sessions Inventaire', index=False)
-            
-            # Formater les colonnes
-            worksheet = writer.sheets['Sessions Inventaire']
-            for idx, col in enumerate(df.columns, 1):
-                max_length = max(
-                    df[col].astype(str).map(len).max(),
-                    len(str(col))
-                )
-                worksheet.column_dimensions[chr(64 + idx)].width = min(max_length + 2, 40)
-        
-        output.seek(0)
-        filename = f'sessions_inventaire_{datetime.now(UTC).strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
-        
+        return export_engine.export_response('inventaires.sessions')
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Validation des sessions d'inventaire
+
+Le stock du dépôt est ramené aux quantités comptées en un nombre constant
+d'instructions, quelle que soit la taille de la session :
+- lecture des lignes de comptage en une requête (colonnes seules, sans ORM) ;
+- lecture verrouillée (FOR UPDATE) des DepotStock concernés en une requête ;
+- calcul des ajustements en mémoire, puis écriture groupée des mouvements,
+  des soldes et du grand livre via stock_mutations.record_movements().
+
+Les grosses sessions sont validées hors requête HTTP par la file de tâches
+(job_queue), avec un état consultable par l'API (InventoryValidationJob) ; la
+validation reste une seule transaction : une session est validée entièrement
+ou pas du tout.
+"""
+
+import os
+from datetime import datetime, UTC
+from decimal import Decimal
+
+from sqlalchemy import func, select
+
+from models import db, InventorySession, InventoryDetail, InventoryValidationJob
+from stock_ledger import LOCATION_DEPOT
+import job_queue
+import stock_mutations
+
+# Au-delà de ce nombre de lignes, la validation part en arrière-plan
+BACKGROUND_THRESHOLD = int(os.getenv('INVENTORY_VALIDATION_BACKGROUND_LINES', '1000'))
+
+
+class InventoryValidationError(ValueError):
+    """Session non validable (introuvable, déjà validée, sans détail)"""
+
+
+def count_lines(session_id):
+    return db.session.execute(
+        select(func.count(InventoryDetail.id)).where(InventoryDetail.session_id == session_id)
+    ).scalar() or 0
+
+
+def validate_session(session_id, validated_by_id):
+    """
+    Valide une session : stock du dépôt = quantité comptée pour chaque écart
+
+    La transaction n'est pas validée ici : l'appelant fait commit ou rollback.
+
+    Args:
+        session_id: Session d'inventaire
+        validated_by_id: Utilisateur qui valide (auteur des mouvements)
+
+    Returns:
+        int: nombre de mouvements d'ajustement générés
+
+    Raises:
+        InventoryValidationError: session introuvable, déjà validée ou vide
+    """
+    # Verrou sur la session : deux validations simultanées ne peuvent pas ajuster deux fois
+    session = db.session.execute(
+        select(InventorySession).where(InventorySession.id == session_id)
+        .with_for_update().execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+    if session is None:
+        raise InventoryValidationError('Session d\'inventaire introuvable')
+    if session.status == 'validated':
+        raise InventoryValidationError('Cette session est déjà validée')
+
+    details = db.session.execute(
+        select(InventoryDetail.stock_item_id, InventoryDetail.counted_quantity,
+               InventoryDetail.variance, InventoryDetail.reason)
+        .where(InventoryDetail.session_id == session_id)
+        .order_by(InventoryDetail.id)
+    ).all()
+    if not details:
+        raise InventoryValidationError('Aucun détail d\'inventaire à valider')
+
+    lines = [detail for detail in details if detail.variance != 0]
+    keys = [(LOCATION_DEPOT, int(session.depot_id), int(detail.stock_item_id)) for detail in lines]
+    levels = stock_mutations.get_levels(keys, lock=True)
+
+    now = datetime.now(UTC)
+    movement_rows = []
+    for key, detail in zip(keys, lines):
+        # La variance = système - compté ; pour ajuster : nouveau_stock = compté
+        # Donc ajustement = compté - stock actuel (relu sous verrou)
+        movement_rows.append({
+            'movement_type': 'adjustment',
+            'movement_date': now,
+            'stock_item_id': detail.stock_item_id,
+            'quantity': Decimal(str(detail.counted_quantity)) - levels[key],  # Peut être positive ou négative
+            'user_id': validated_by_id,
+            'to_depot_id': session.depot_id,
+            'reason': f"Inventaire session {session.id}: {detail.reason or 'Ajustement suite inventaire'}",
+            'inventory_session_id': session.id,
+        })
+    stock_mutations.record_movements(movement_rows, allow_negative=True)
+
+    session.status = 'validated'
+    session.validated_at = now
+    session.validated_by_id = validated_by_id
+    return len(movement_rows)
+
+
+# =========================================================
+# VALIDATION EN ARRIÈRE-PLAN (GROSSES SESSIONS)
+# =========================================================
+
+def job_progress(job):
+    """État d'un job pour l'API"""
+    if job is None:
+        return None
+    return {
+        'id': job.id,
+        'session_id': job.session_id,
+        'status': job.status,
+        'total_lines': job.total_lines,
+        'adjustments': job.adjustments,
+        'percent': 100.0 if job.status == 'completed' else 0.0,
+        'error': job.error,
+        'stale': job_queue.record_abandoned(job),
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def latest_job(session_id):
+    return db.session.scalars(
+        select(InventoryValidationJob)
+        .where(InventoryValidationJob.session_id == session_id)
+        .order_by(InventoryValidationJob.id.desc()).limit(1)
+    ).first()
+
+
+def start_validation(session_id, requested_by_id=None, run_async=True):
+    """
+    Lance la validation d'une session hors requête HTTP (tâche de la file job_queue)
+
+    Un job actif et vivant pour la même session est renvoyé tel quel ; un job
+    abandonné ou en échec est relancé (la validation étant atomique, il
+    repart de zéro).
+
+    Args:
+        run_async: False pour valider immédiatement dans ce processus (scripts, tests)
+
+    Returns:
+        InventoryValidationJob
+    """
+    job = latest_job(session_id)
+    if job is not None and job.status in job_queue.RECORD_ACTIVE_STATUSES and not job_queue.record_abandoned(job):
+        return job
+    if job is None or job.status not in job_queue.RECORD_ACTIVE_STATUSES + ('failed',):
+        job = InventoryValidationJob(
+            session_id=session_id,
+            status='pending',
+            total_lines=count_lines(session_id),
+            requested_by_id=requested_by_id
+        )
+        db.session.add(job)
+        db.session.flush()
+    else:
+        job.status = 'pending'
+    if run_async:
+        job_queue.enqueue_for(job, 'inventory.validate_session', {'job_id': job.id})
+        db.session.commit()
+        return job
+    db.session.commit()
+    run_job(job.id)
+    db.session.refresh(job)
+    return job
+
+
+def run_job(job_id):
+    """
+    Exécute un job de validation ; l'état final du job est écrit dans la même
+    transaction que les ajustements
+
+    Returns:
+        bool: True si la session a été validée par cet appel
+    """
+    if not job_queue.claim_record(InventoryValidationJob, job_id):
+        return False
+
+    job = db.session.get(InventoryValidationJob, job_id)
+    try:
+        job.adjustments = validate_session(job.session_id, job.requested_by_id)
+        job.status = 'completed'
+        job.finished_at = datetime.now(UTC)
+        db.session.commit()
+        print(f"✅ Session d'inventaire {job.session_id} validée ({job.adjustments} ajustement(s))")
+        return True
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Erreur lors de la validation de la session d'inventaire (job {job_id}): {e}")
+        job = db.session.get(InventoryValidationJob, job_id)
+        if job is not None:
+            job.status = 'failed'
+            job.error = str(e)[:2000]
+            job.finished_at = datetime.now(UTC)
+            db.session.commit()
+        return False
+
+
+@job_queue.task('inventory.validate_session', queue='inventory')
+def validate_session_task(job_id):
+    """Tâche de la file : l'échec de la validation est enregistré dans le job (relançable par l'API)"""
+    return {'validated': run_job(job_id)}
@@ -0,0 +1,620 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File de tâches durable (table background_jobs)
+
+Les appels aux API externes (notifications WhatsApp/SMS, envois de la console
+Message Pro, rapports planifiés) ne s'exécutent plus dans la requête HTTP : la
+requête enregistre une tâche dans la même transaction que l'action métier et
+un worker l'exécute ensuite. La latence de la requête ne dépend plus de l'API.
+
+- Durabilité : la table est la source de vérité ; Redis (REDIS_URL) ne sert
+  qu'à réveiller les workers sans attendre l'intervalle de scrutation.
+- Réservation : UPDATE conditionnel par tâche (un seul exécutant, même avec
+  plusieurs workers), précédé de FOR UPDATE SKIP LOCKED sur PostgreSQL/MySQL.
+- Reprises : une tâche qui lève une exception est replanifiée avec un backoff
+  exponentiel (avec gigue) ; après max_attempts elle passe en 'dead' (file des
+  échecs, consultable et relançable depuis /notifications/jobs).
+- Idempotence : une clé unique optionnelle ; ré-enregistrer la même clé
+  renvoie la tâche existante sans en créer une nouvelle.
+- Traitements longs avec un état métier consultable (validation d'inventaire,
+  réindexation) : l'enregistrement d'état pointe vers la tâche responsable
+  (enqueue_for / claim_record / record_abandoned) ; la file se charge de la
+  réservation, du battement et de la reprise.
+- Progression : update_payload() note dans le payload ce qu'une tâche a déjà
+  fait (ex. destinataires notifiés) ; une nouvelle tentative le reçoit en
+  argument et ne refait que le reste.
+- Une tâche 'running' dont le worker a disparu est reprise après
+  VISIBILITY_TIMEOUT. Les tâches sont réservées une par une, la réservation
+  est prolongée juste avant l'exécution puis par un battement (locked_at)
+  tant que la tâche tourne : une tâche longue n'est pas reprise par un autre
+  worker pendant son exécution.
+
+Exécution : `python job_queue.py worker` (processus dédié, voir Procfile et
+render.yaml) ou thread intégré au processus web (JOB_QUEUE_EMBEDDED_WORKER=1,
+défaut, pour le développement et les déploiements sans worker dédié).
+"""
+
+import argparse
+import importlib
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import db, BackgroundJob
+
+# Modules qui enregistrent des tâches (@task) : importés par les workers
+TASK_MODULES = ('notifications_automatiques', 'messaging', 'scheduled_reports', 'export_engine',
+                'inventory_validation', 'search_indexer')
+
+DEFAULT_MAX_ATTEMPTS = int(os.getenv('JOB_QUEUE_MAX_ATTEMPTS', '5'))
+BACKOFF_BASE = int(os.getenv('JOB_QUEUE_BACKOFF_SECONDS', '30'))
+BACKOFF_MAX = int(os.getenv('JOB_QUEUE_BACKOFF_MAX_SECONDS', '3600'))
+VISIBILITY_TIMEOUT = timedelta(seconds=int(os.getenv('JOB_QUEUE_VISIBILITY_TIMEOUT', '900')))
+POLL_INTERVAL = float(os.getenv('JOB_QUEUE_POLL_INTERVAL', '5'))
+BATCH_SIZE = int(os.getenv('JOB_QUEUE_BATCH_SIZE', '10'))
+# Intervalle de prolongation de la réservation d'une tâche en cours (secondes)
+HEARTBEAT_INTERVAL = VISIBILITY_TIMEOUT.total_seconds() / 3
+EMBEDDED_WORKER = os.getenv('JOB_QUEUE_EMBEDDED_WORKER', '1') == '1'
+
+WAKEUP_KEY = 'job_queue:wakeup'
+
+STATUSES = ('pending', 'running', 'succeeded', 'dead')
+
+_tasks = {}  # nom -> (fonction, file, max_attempts)
+_modules_loaded = False
+_wakeup = threading.Event()
+_embedded_lock = threading.Lock()
+_embedded_pid = None
+_redis = None
+_redis_checked = False
+_current = threading.local()  # tâche exécutée par le thread : (job_id, worker)
+
+
+class PermanentJobError(Exception):
+    """Échec définitif : la tâche passe directement en 'dead', sans nouvelle tentative"""
+
+
+def task(name, queue='default', max_attempts=None):
+    """Enregistre une fonction comme tâche ; elle reçoit le payload en arguments nommés"""
+    def decorator(func):
+        _tasks[name] = (func, queue, max_attempts)
+        return func
+    return decorator
+
+
+def _load_task_modules():
+    global _modules_loaded
+    if _modules_loaded:
+        return
+    _modules_loaded = True
+    for module_name in TASK_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            print(f"⚠️ File de tâches: module {module_name} non chargé ({e})")
+
+
+def _get_task(name):
+    if name not in _tasks:
+        _load_task_modules()
+    return _tasks.get(name)
+
+
+def _get_redis():
+    """Client Redis pour le réveil des workers (None si REDIS_URL absent ou injoignable)"""
+    global _redis, _redis_checked
+    if not _redis_checked:
+        _redis_checked = True
+        redis_url = os.getenv('REDIS_URL', '')
+        if redis_url and redis_url != 'memory://' and redis_url.startswith(('redis://', 'rediss://')):
+            try:
+                import redis
+                client = redis.Redis.from_url(redis_url, socket_timeout=POLL_INTERVAL + 5)
+                client.ping()
+                _redis = client
+            except Exception as e:
+                print(f"⚠️ File de tâches: Redis indisponible ({e}), réveil par scrutation de la table")
+    return _redis
+
+
+def _worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _insert_ignore(table):
+    """INSERT qui ignore une clé d'idempotence déjà enregistrée"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        return dialect_insert(table).on_conflict_do_nothing(index_elements=['idempotency_key'])
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        return dialect_insert(table).on_conflict_do_nothing(index_elements=['idempotency_key'])
+    if dialect == 'mysql':
+        return insert(table).prefix_with('IGNORE')
+    return insert(table)
+
+
+# =========================================================
+# ENREGISTREMENT DES TÂCHES
+# =========================================================
+
+def enqueue(task_name, payload=None, idempotency_key=None, delay=None, max_attempts=None):
+    """
+    Enregistre une tâche dans la transaction de db.session (l'appelant valide)
+
+    Args:
+        task_name: Nom enregistré via @task
+        payload: Arguments nommés sérialisables en JSON (identifiants, pas d'objets ORM)
+        idempotency_key: Clé unique optionnelle (ex: 'commande_validee:42')
+        delay: Délai avant la première exécution (secondes ou timedelta)
+        max_attempts: Nombre maximal de tentatives (défaut : celui de la tâche)
+
+    Returns:
+        int: identifiant de la tâche (la tâche existante si la clé est déjà connue)
+    """
+    registered = _get_task(task_name)
+    if registered is None:
+        raise ValueError(f"Tâche inconnue: {task_name}")
+    _, queue, task_max_attempts = registered
+
+    now = datetime.now(UTC)
+    if delay is not None and not isinstance(delay, timedelta):
+        delay = timedelta(seconds=delay)
+    values = {
+        'queue': queue,
+        'task': task_name,
+        'payload': payload or {},
+        'idempotency_key': idempotency_key,
+        'status': 'pending',
+        'attempts': 0,
+        'max_attempts': max_attempts or task_max_attempts or DEFAULT_MAX_ATTEMPTS,
+        'run_after': now + delay if delay else now,
+        'created_at': now,
+    }
+    table = BackgroundJob.__table__
+    if idempotency_key:
+        db.session.execute(_insert_ignore(table), [values])
+        job_id = db.session.execute(
+            select(table.c.id).where(table.c.idempotency_key == idempotency_key)
+        ).scalar_one()
+    else:
+        job_id = db.session.execute(insert(table).values(values)).inserted_primary_key[0]
+
+    db.session.info['job_queue_wakeup'] = True
+    _ensure_embedded_worker()
+    return job_id
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers_after_commit(session):
+    if session.info.pop('job_queue_wakeup', None):
+        _wakeup.set()
+        client = _get_redis()
+        if client is not None:
+            try:
+                client.lpush(WAKEUP_KEY, 1)
+                client.ltrim(WAKEUP_KEY, 0, 99)
+            except Exception as e:
+                print(f"⚠️ File de tâches: réveil Redis impossible ({e})")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_wakeup_after_rollback(session):
+    session.info.pop('job_queue_wakeup', None)
+
+
+# =========================================================
+# EXÉCUTION
+# =========================================================
+
+def _backoff(attempts):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(attempts - 1, 0))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def _claimable(now, queues=None):
+    condition = (
+        ((BackgroundJob.status == 'pending') & (BackgroundJob.run_after <= now))
+        | ((BackgroundJob.status == 'running') & (BackgroundJob.locked_at < now - VISIBILITY_TIMEOUT))
+    )
+    if queues:
+        condition = condition & BackgroundJob.queue.in_(list(queues))
+    return condition
+
+
+def claim_jobs(worker=None, queues=None, limit=None):
+    """
+    Réserve jusqu'à `limit` tâches prêtes pour ce worker
+
+    Returns:
+        list: identifiants des tâches réservées (tentative déjà comptée)
+    """
+    worker = worker or _worker_name()
+    now = datetime.now(UTC)
+    condition = _claimable(now, queues)
+    candidates = (
+        select(BackgroundJob.id).where(condition)
+        .order_by(BackgroundJob.run_after, BackgroundJob.id)
+        .limit(limit or BATCH_SIZE)
+    )
+    if db.session.get_bind().dialect.name in ('postgresql', 'mysql'):
+        candidates = candidates.with_for_update(skip_locked=True)
+
+    claimed = []
+    for job_id in db.session.execute(candidates).scalars().all():
+        result = db.session.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.id == job_id, condition)
+            .values(status='running', locked_by=worker, locked_at=now, attempts=BackgroundJob.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            claimed.append(job_id)
+    db.session.commit()
+    return claimed
+
+
+def _extend_lock(executor, job_id, worker):
+    """Repousse locked_at si ce worker détient toujours la tâche ; False sinon"""
+    table = BackgroundJob.__table__
+    result = executor.execute(
+        update(table)
+        .where(table.c.id == job_id, table.c.status == 'running', table.c.locked_by == worker)
+        .values(locked_at=datetime.now(UTC))
+    )
+    return result.rowcount == 1
+
+
+class _Heartbeat:
+    """Prolonge la réservation d'une tâche (locked_at) tant qu'elle s'exécute, sur sa propre connexion"""
+
+    def __init__(self, job_id, worker):
+        self.job_id = job_id
+        self.worker = worker
+        self._engine = db.engine
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'job-heartbeat-{job_id}', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                with self._engine.begin() as connection:
+                    if not _extend_lock(connection, self.job_id, self.worker):
+                        print(f"⚠️ Tâche {self.job_id}: réservation perdue par {self.worker}")
+                        return
+            except Exception as e:
+                print(f"⚠️ Tâche {self.job_id}: prolongation de la réservation impossible ({e})")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def current_job_id():
+    """Identifiant de la tâche exécutée par ce thread (None hors d'une tâche)"""
+    job = getattr(_current, 'job', None)
+    return job[0] if job else None
+
+
+def update_payload(**values):
+    """
+    Complète tout de suite le payload de la tâche en cours, hors de sa transaction
+
+    Les valeurs sont repassées en arguments à la tâche lors des nouvelles tentatives : une tâche
+    y note ce qui est déjà fait (ex. destinataires déjà notifiés) pour ne pas le refaire.
+
+    Returns:
+        bool: False hors d'une tâche ou si la réservation a été perdue
+    """
+    job = getattr(_current, 'job', None)
+    if job is None:
+        return False
+    job_id, worker = job
+    table = BackgroundJob.__table__
+    owned = (table.c.id == job_id, table.c.status == 'running', table.c.locked_by == worker)
+    with db.engine.begin() as connection:
+        row = connection.execute(select(table.c.payload).where(*owned)).first()
+        if row is None:
+            return False
+        result = connection.execute(update(table).where(*owned).values(payload=dict(row.payload or {}, **values)))
+        return result.rowcount == 1
+
+
+def _finish(job_id, worker, **values):
+    """Écrit l'issue d'une tâche si ce worker en est toujours l'exécutant"""
+    db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job_id, BackgroundJob.status == 'running', BackgroundJob.locked_by == worker)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _json_result(value):
+    return value if isinstance(value, (dict, list, str, int, float, bool)) else None
+
+
+def run_job(job_id, worker=None):
+    """
+    Exécute une tâche réservée
+
+    Returns:
+        bool: True si la tâche a réussi
+    """
+    worker = worker or _worker_name()
+    # Réservation prolongée juste avant l'exécution, si ce worker la détient toujours
+    if not _extend_lock(db.session, job_id, worker):
+        db.session.commit()
+        return False
+    job = db.session.get(BackgroundJob, job_id)
+    task_name, payload, attempts, max_attempts = job.task, dict(job.payload or {}), job.attempts, job.max_attempts
+    db.session.commit()  # pas de transaction ouverte pendant l'appel externe
+
+    started = time.perf_counter()
+    try:
+        registered = _get_task(task_name)
+        if registered is None:
+            raise PermanentJobError(f"Tâche inconnue: {task_name}")
+        if attempts > max_attempts:
+            raise PermanentJobError("Nombre maximal de tentatives atteint (worker interrompu)")
+        _current.job = (job_id, worker)
+        try:
+            with _Heartbeat(job_id, worker):
+                result = registered[0](**payload)
+        finally:
+            _current.job = None
+        db.session.commit()  # écritures éventuelles de la tâche
+    except Exception as e:
+        db.session.rollback()
+        error = f"{type(e).__name__}: {e}"[:2000]
+        now = datetime.now(UTC)
+        if isinstance(e, PermanentJobError) or attempts >= max_attempts:
+            print(f"⚠️ Tâche {job_id} ({task_name}) en échec définitif: {error}")
+            _finish(job_id, worker, status='dead', last_error=error, finished_at=now, locked_by=None)
+        else:
+            retry_in = _backoff(attempts)
+            print(f"⚠️ Tâche {job_id} ({task_name}) en échec, tentative {attempts}/{max_attempts}, "
+                  f"nouvel essai dans {int(retry_in.total_seconds())}s: {error}")
+            _finish(job_id, worker, status='pending', last_error=error, run_after=now + retry_in, locked_by=None)
+        return False
+
+    _finish(job_id, worker, status='succeeded', result=_json_result(result), last_error=None,
+            finished_at=datetime.now(UTC), locked_by=None)
+    print(f"✅ Tâche {job_id} ({task_name}) exécutée en {time.perf_counter() - started:.2f}s")
+    return True
+
+
+def process_available(queues=None, limit=None, worker=None):
+    """
+    Réserve puis exécute les tâches prêtes une par une ; renvoie le nombre de tâches traitées
+
+    Une tâche n'est réservée qu'au moment de l'exécuter : les suivantes restent disponibles
+    pour les autres workers au lieu d'attendre dans un lot dont la réservation expirerait.
+    """
+    worker = worker or _worker_name()
+    processed = 0
+    while not (limit and processed >= limit):
+        claimed = claim_jobs(worker=worker, queues=queues, limit=1)
+        if not claimed:
+            break
+        run_job(claimed[0], worker=worker)
+        processed += 1
+    return processed
+
+
+def _wait_for_work(timeout):
+    client = _get_redis()
+    if client is not None:
+        try:
+            client.brpop(WAKEUP_KEY, timeout=max(int(timeout), 1))
+            return
+        except Exception:
+            pass
+    _wakeup.wait(timeout)
+    _wakeup.clear()
+
+
+def run_worker(queues=None, stop_event=None, poll_interval=None):
+    """Boucle du worker (appelée dans un contexte d'application)"""
+    poll_interval = poll_interval or POLL_INTERVAL
+    worker = _worker_name()
+    _load_task_modules()
+    print(f"🔄 Worker de tâches {worker} démarré (files: {', '.join(queues) if queues else 'toutes'})")
+    while not (stop_event and stop_event.is_set()):
+        try:
+            processed = process_available(queues=queues, worker=worker)
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Worker de tâches: erreur de scrutation ({e})")
+            processed = 0
+        finally:
+            db.session.remove()
+        if not processed:
+            _wait_for_work(poll_interval)
+
+
+def _ensure_embedded_worker():
+    """Démarre le thread worker du processus courant (une fois par processus, après fork compris)"""
+    global _embedded_pid
+    if not EMBEDDED_WORKER or _embedded_pid == os.getpid():
+        return
+    from flask import current_app
+    try:
+        app = current_app._get_current_object()
+    except RuntimeError:
+        return
+    with _embedded_lock:
+        if _embedded_pid == os.getpid():
+            return
+        _embedded_pid = os.getpid()
+
+        def run():
+            with app.app_context():
+                run_worker()
+
+        threading.Thread(target=run, name='job-queue-worker', daemon=True).start()
+
+
+# =========================================================
+# ENREGISTREMENTS D'ÉTAT MÉTIER (jobs de validation, de réindexation...)
+# =========================================================
+# Modèles avec status (pending, running, completed, failed...), worker, started_at,
+# heartbeat_at et error ; la colonne worker désigne la tâche responsable (job_queue:<id>).
+
+RECORD_ACTIVE_STATUSES = ('pending', 'running')
+_RECORD_MARKER = 'job_queue:'
+
+
+def _record_job_id(record):
+    worker = record.worker or ''
+    return int(worker[len(_RECORD_MARKER):]) if worker.startswith(_RECORD_MARKER) else None
+
+
+def _naive(value):
+    return value.replace(tzinfo=None) if value is not None and value.tzinfo else value
+
+
+def enqueue_for(record, task_name, payload=None):
+    """
+    Enregistre la tâche qui exécutera un enregistrement d'état (dans la transaction de l'appelant)
+
+    Seule la dernière tâche enregistrée pour lui peut le prendre : une tâche plus ancienne
+    encore en file (double clic, relance) n'exécute rien.
+    """
+    job_id = enqueue(task_name, payload)
+    record.worker = f'{_RECORD_MARKER}{job_id}'
+    return job_id
+
+
+def claim_record(model, record_id):
+    """
+    Passe un enregistrement d'état en 'running' pour l'exécution courante (validé aussitôt)
+
+    Depuis une tâche : seulement si elle en est responsable (y compris quand la file la reprend
+    après l'arrêt de son worker) ; en exécution directe (scripts, tests) : seulement s'il n'est
+    pas déjà en cours.
+
+    Returns:
+        bool: True si l'appelant doit exécuter le traitement
+    """
+    now = datetime.now(UTC)
+    job_id = current_job_id()
+    if job_id is not None:
+        owned = (model.status.in_(('pending', 'running', 'failed')), model.worker == f'{_RECORD_MARKER}{job_id}')
+        values = {}
+    else:
+        owned = (model.status.in_(('pending', 'failed')),)
+        values = {'worker': _worker_name()}
+    result = db.session.execute(
+        update(model)
+        .where(model.id == record_id, *owned)
+        .values(status='running', heartbeat_at=now, error=None,
+                started_at=func.coalesce(model.started_at, now), **values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def record_abandoned(record):
+    """
+    Enregistrement resté actif sans exécutant : sa tâche a quitté la file sans le terminer
+    (échec définitif, tâche remplacée), ou exécution directe sans battement depuis VISIBILITY_TIMEOUT
+    """
+    if record.status not in RECORD_ACTIVE_STATUSES:
+        return False
+    job_id = _record_job_id(record)
+    if job_id is not None:
+        job = db.session.get(BackgroundJob, job_id)
+        return job is None or job.status in ('succeeded', 'dead')
+    heartbeat = _naive(record.heartbeat_at or record.started_at or record.created_at)
+    return heartbeat is None or _naive(datetime.now(UTC)) - heartbeat > VISIBILITY_TIMEOUT
+
+
+# =========================================================
+# SUIVI ET FILE DES ÉCHECS
+# =========================================================
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'queue': job.queue,
+        'task': job.task,
+        'payload': job.payload,
+        'idempotency_key': job.idempotency_key,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'run_after': job.run_after.isoformat() if job.run_after else None,
+        'last_error': job.last_error,
+        'result': job.result,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def stats():
+    """Nombre de tâches par statut"""
+    counts = dict(db.session.execute(
+        select(BackgroundJob.status, func.count(BackgroundJob.id)).group_by(BackgroundJob.status)
+    ).all())
+    return {status: counts.get(status, 0) for status in STATUSES}
+
+
+def list_jobs(status='dead', limit=100):
+    return db.session.scalars(
+        select(BackgroundJob).where(BackgroundJob.status == status)
+        .order_by(BackgroundJob.id.desc()).limit(limit)
+    ).all()
+
+
+def retry_job(job_id):
+    """Replanifie immédiatement une tâche de la file des échecs (compteur de tentatives remis à zéro)"""
+    result = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job_id, BackgroundJob.status == 'dead')
+        .values(status='pending', attempts=0, run_after=datetime.now(UTC), finished_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.info['job_queue_wakeup'] = True
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Worker de la file de tâches")
+    parser.add_argument('command', choices=['worker', 'stats'])
+    parser.add_argument('--queue', action='append', dest='queues', help="File à traiter (répétable, défaut : toutes)")
+    args = parser.parse_args(argv)
+
+    global EMBEDDED_WORKER
+    EMBEDDED_WORKER = False  # ce processus est lui-même le worker
+    # Le worker ne planifie pas les rapports : c'est le rôle du processus web / planificateur
+    os.environ.setdefault('DISABLE_SCHEDULER', '1')
+    from app import app
+
+    with app.app_context():
+        if args.command == 'stats':
+            print(stats())
+            return
+        run_worker(queues=args.queues)
+
+
+if __name__ == '__main__':
+    # Passer par le module importé : les tâches s'enregistrent dans job_queue, pas dans __main__
+    import job_queue
+    job_queue.main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Moteur de prix de revient (landed cost) des simulations
+
+Un seul jeu de formules pour toutes les vues (détail, prévisualisation, PDF,
+Excel, KPIs analytiques) et l'API de rentabilité :
+
+- prix d'achat converti en GNF selon la devise de l'article (USD par défaut,
+  EUR, XOF ou à défaut USD) ;
+- coûts logistiques = fixes (douane, manutention, autres, transport fixe)
+  + variables (transport au kg x poids total) ;
+- répartition par article au prorata de la valeur ou du poids
+  (base 'weight' sans poids saisi : prorata de la valeur) ;
+- prix de revient unitaire, marge et taux de marge sur prix de revient.
+
+Les formules sont écrites une fois, en opérations sur tableaux numpy :
+- landed_costs() : tableaux d'objets Decimal, résultat exact identique aux
+  anciens calculs article par article (montants affichés et exportés) ;
+- evaluate_scenarios() : tableaux float64 de forme (scénarios, articles)
+  pour évaluer d'un coup des grilles de variantes (taux de change, douane,
+  transport au kg, capacité du camion...).
+"""
+
+from decimal import Decimal, ROUND_CEILING
+
+import numpy as np
+
+# Paramètres d'une simulation utilisés par le calcul
+PARAMETERS = ('rate_usd', 'rate_eur', 'rate_xof', 'customs_gnf', 'handling_gnf', 'others_gnf',
+              'transport_fixed_gnf', 'transport_per_kg_gnf', 'truck_capacity_tons')
+
+# Colonnes numériques d'un article de simulation
+ITEM_FIELDS = ('purchase_price', 'quantity', 'unit_weight_kg', 'selling_price_gnf')
+
+CURRENCIES = ('GNF', 'USD', 'EUR', 'XOF')
+
+ZERO = Decimal('0')
+
+
+def _get(source, name, default=None):
+    value = source.get(name, default) if isinstance(source, dict) else getattr(source, name, default)
+    return default if value is None else value
+
+
+def _decimal(value):
+    return Decimal(str(value)) if value is not None else ZERO
+
+
+def simulation_parameters(simulation):
+    """
+    Paramètres de calcul d'une simulation (objet Simulation ou dict) en Decimal
+
+    Returns:
+        dict: taux, coûts, capacité du camion et base de répartition ('value' ou 'weight')
+    """
+    parameters = {name: _decimal(_get(simulation, name)) for name in PARAMETERS}
+    parameters['basis'] = _get(simulation, 'basis', 'value')
+    return parameters
+
+
+def item_columns(items):
+    """
+    Colonnes des articles (objets SimulationItem ou dicts) en tableaux d'objets Decimal
+
+    Returns:
+        dict: purchase_price, quantity, unit_weight_kg, selling_price_gnf, purchase_currency
+    """
+    columns = {name: np.array([_decimal(_get(item, name)) for item in items], dtype=object)
+               for name in ITEM_FIELDS}
+    columns['purchase_currency'] = np.array([_get(item, 'purchase_currency', 'USD') for item in items],
+                                            dtype=object)
+    return columns
+
+
+def conversion_rate(simulation, currency):
+    """Taux GNF -> devise d'affichage (None pour GNF ou un taux non renseigné)"""
+    if currency not in ('USD', 'EUR', 'XOF'):
+        return None
+    rate = _get(simulation, f'rate_{currency.lower()}')
+    return float(rate) if rate else None
+
+
+def _divide(numerator, denominator, zero):
+    """numerator / denominator, zero là où le dénominateur n'est pas strictement positif"""
+    positive = denominator > 0
+    return np.where(positive, numerator / np.where(positive, denominator, 1), zero)
+
+
+def _evaluate(p, c, zero):
+    """
+    Calcul vectoriel commun aux deux chemins
+
+    p : paramètres, scalaires ou colonnes de forme (S, 1) pour S scénarios
+    c : colonnes des articles, tableaux de forme (N,)
+    Les totaux gardent un axe de longueur 1 pour se diffuser sur les articles.
+    """
+    currency = c['purchase_currency']
+    xof_rate = np.where(p['rate_xof'] != 0, p['rate_xof'], p['rate_usd'])
+    rate = np.where(currency == 'EUR', p['rate_eur'], np.where(currency == 'XOF', xof_rate, p['rate_usd']))
+
+    quantity = c['quantity']
+    purchase_price_gnf = c['purchase_price'] * rate
+    item_value = purchase_price_gnf * quantity
+    item_weight = quantity * c['unit_weight_kg']
+    item_selling = c['selling_price_gnf'] * quantity
+
+    total_purchase_value = item_value.sum(axis=-1, keepdims=True) + zero
+    total_weight = item_weight.sum() + zero
+    total_selling_value = item_selling.sum(axis=-1, keepdims=True) + zero
+
+    total_fixed_costs = p['customs_gnf'] + p['handling_gnf'] + p['others_gnf'] + p['transport_fixed_gnf']
+    total_variable_costs = p['transport_per_kg_gnf'] * total_weight
+    total_logistics = np.asarray(total_fixed_costs + total_variable_costs).reshape(-1, 1)
+
+    # Répartition : le poids ne varie pas d'un scénario à l'autre
+    if p['basis'] == 'weight' and total_weight > 0:
+        logistics_cost = (total_logistics * item_weight) / total_weight
+    else:
+        logistics_cost = _divide(total_logistics * item_value, total_purchase_value, zero)
+
+    logistics_per_unit = _divide(logistics_cost, quantity, zero)
+    cost_price_per_unit = purchase_price_gnf + logistics_per_unit
+    margin = c['selling_price_gnf'] - cost_price_per_unit
+    margin_pct = _divide(margin, cost_price_per_unit, zero) * 100
+
+    total_cost = total_purchase_value + total_logistics
+    total_margin = total_selling_value - total_cost
+
+    capacity_kg = np.asarray(p['truck_capacity_tons'] * 1000).reshape(-1, 1)
+    return {
+        'purchase_price_gnf': purchase_price_gnf,
+        'item_value': item_value,
+        'item_weight': item_weight,
+        'logistics_cost': logistics_cost,
+        'logistics_per_unit': logistics_per_unit,
+        'cost_price_per_unit': cost_price_per_unit,
+        'total_cost': cost_price_per_unit * quantity,
+        'total_selling': item_selling,
+        'margin': margin,
+        'margin_pct': margin_pct,
+        'totals': {
+            'total_purchase_value': total_purchase_value,
+            'total_weight': total_weight,
+            'total_selling_value': total_selling_value,
+            'total_fixed_costs': total_fixed_costs,
+            'total_variable_costs': total_variable_costs,
+            'total_logistics': total_logistics,
+            'total_cost': total_cost,
+            'total_margin': total_margin,
+            'margin_pct': _divide(total_margin, total_cost, zero) * 100,
+            'truck_utilization_pct': _divide(total_weight, capacity_kg, zero) * 100,
+            'truck_overflow': (capacity_kg > 0) & (total_weight > capacity_kg),
+        },
+    }
+
+
+def _scalar(value):
+    """Valeur d'un total ou d'une cellule (scalaire, tableau 0-d ou de forme (1,) / (1, 1))"""
+    return np.asarray(value, dtype=object).reshape(-1)[0]
+
+
+class LandedCost:
+    """Prix de revient exact (Decimal) d'une simulation : lignes par article et totaux"""
+
+    TOTALS = ('total_purchase_value', 'total_weight', 'total_selling_value', 'total_fixed_costs',
+              'total_variable_costs', 'total_logistics', 'total_cost', 'total_margin', 'margin_pct',
+              'truck_utilization_pct', 'truck_overflow')
+
+    LINE_FIELDS = ('purchase_price_gnf', 'item_value', 'item_weight', 'logistics_cost', 'logistics_per_unit',
+                   'cost_price_per_unit', 'total_cost', 'total_selling', 'margin', 'margin_pct')
+
+    def __init__(self, items, result, columns):
+        self.lines = []
+        for index, item in enumerate(items):
+            line = {'item': item, 'quantity': columns['quantity'][index],
+                    'selling_price': columns['selling_price_gnf'][index]}
+            line.update({field: _scalar(result[field][..., index]) for field in self.LINE_FIELDS})
+            self.lines.append(line)
+        for name in self.TOTALS:
+            setattr(self, name, _scalar(result['totals'][name]))
+        self.truck_overflow = bool(self.truck_overflow)
+
+
+def landed_costs(simulation, items):
+    """
+    Prix de revient exact d'une simulation
+
+    Args:
+        simulation: Simulation ou dict de paramètres
+        items: SimulationItem ou dicts (purchase_price, purchase_currency, quantity,
+               unit_weight_kg, selling_price_gnf)
+
+    Returns:
+        LandedCost: lignes au format items_with_cost des vues et totaux
+    """
+    items = list(items)
+    columns = item_columns(items)
+    result = _evaluate(simulation_parameters(simulation), columns, ZERO)
+    return LandedCost(items, result, columns)
+
+
+class ScenarioGrid:
+    """
+    Résultats float64 d'une grille de scénarios
+
+    Les totaux sont des tableaux de forme (S,), les valeurs par article (préfixées item_
+    quand le nom existe aussi en total) de forme (S, N).
+    """
+
+    ITEM_FIELDS = {'purchase_price_gnf': 'purchase_price_gnf', 'logistics_per_unit': 'logistics_per_unit',
+                   'cost_price_per_unit': 'cost_price_per_unit', 'margin': 'item_margin',
+                   'margin_pct': 'item_margin_pct'}
+
+    def __init__(self, result, count, items_count):
+        self.count = count
+        for name, value in result['totals'].items():
+            dtype = bool if name == 'truck_overflow' else float
+            setattr(self, name, np.broadcast_to(np.asarray(value, dtype=dtype).reshape(-1), (count,)))
+        for field, name in self.ITEM_FIELDS.items():
+            setattr(self, name, np.broadcast_to(np.asarray(result[field], dtype=float), (count, items_count)))
+
+
+def evaluate_scenarios(simulation, items, scenarios=None):
+    """
+    Évalue d'un coup une grille de scénarios what-if (float64)
+
+    Args:
+        simulation: Simulation ou dict de paramètres de base
+        items: SimulationItem ou dicts
+        scenarios: {paramètre: liste de valeurs}, toutes les listes de même longueur S ;
+                   les paramètres absents gardent leur valeur de base
+
+    Returns:
+        ScenarioGrid
+    """
+    scenarios = scenarios or {}
+    unknown = set(scenarios) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f"Paramètre(s) de scénario inconnu(s) : {', '.join(sorted(unknown))}")
+    lengths = {len(values) for values in scenarios.values()}
+    if len(lengths) > 1:
+        raise ValueError("Toutes les variantes d'une grille de scénarios doivent avoir la même longueur")
+    count = lengths.pop() if lengths else 1
+
+    base = simulation_parameters(simulation)
+    parameters = {'basis': base['basis']}
+    for name in PARAMETERS:
+        if name in scenarios:
+            parameters[name] = np.asarray([float(v) for v in scenarios[name]], dtype=float).reshape(-1, 1)
+        else:
+            parameters[name] = float(base[name])
+
+    columns = item_columns(list(items))
+    for name in ITEM_FIELDS:
+        columns[name] = columns[name].astype(float)
+    return ScenarioGrid(_evaluate(parameters, columns, 0.0), count, len(columns['quantity']))
+
+
+def price_for_margin(cost_price_per_unit, target_margin_pct, step=None):
+    """
+    Prix de vente minimal atteignant le taux de marge visé sur le prix de revient
+
+    Arrondi au centime supérieur, ou au multiple supérieur de step (ex. 500 GNF).
+    """
+    price = _decimal(cost_price_per_unit) * (1 + _decimal(target_margin_pct) / 100)
+    step = _decimal(step) if step else Decimal('0.01')
+    return (price / step).to_integral_value(rounding=ROUND_CEILING) * step
+
+
+def with_selling_prices(items, prices):
+    """Copie des articles (dicts) avec de nouveaux prix de vente, pour réévaluer une simulation"""
+    return [dict({name: _get(item, name) for name in ITEM_FIELDS + ('purchase_currency', 'article_id')},
+                 selling_price_gnf=price)
+            for item, price in zip(items, prices)]
@@ -3,43 +3,169 @@
 """
 Module d'intégration API Message Pro
 Service pour envoyer des SMS, WhatsApp, OTP via l'API Message Pro
+
+Tous les clients d'un processus partagent une session HTTP (pool de
+connexions keep-alive, nouvelles tentatives avec backoff sur 429/5xx pour les
+lectures), une limite d'appels simultanés, un cache TTL des lectures peu
+changeantes (comptes WhatsApp, groupes, tarifs, appareils) et des métriques de
+latence et d'erreurs par endpoint (get_metrics(), /messaging/api/metrics).
 """
 
-import requests
+import copy
+import hashlib
 import os
+import threading
+import time
 from typing import Dict, Optional, List, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import current_app
 
+# Pool de connexions partagé (keep-alive et réutilisation TLS entre les appels)
+POOL_SIZE = int(os.getenv('MESSAGEPRO_POOL_SIZE', '10'))
+# Nombre maximal d'appels simultanés vers l'API (tous threads du processus)
+MAX_CONCURRENCY = int(os.getenv('MESSAGEPRO_MAX_CONCURRENCY', '8'))
+# Nouvelles tentatives sur 429/5xx (lectures uniquement : un envoi n'est jamais rejoué
+# après réception par le serveur) et sur échec de connexion
+RETRIES = int(os.getenv('MESSAGEPRO_RETRIES', '3'))
+RETRY_BACKOFF = float(os.getenv('MESSAGEPRO_RETRY_BACKOFF', '0.5'))
+TIMEOUT = float(os.getenv('MESSAGEPRO_TIMEOUT', '30'))
+# Durée de vie du cache des lectures peu changeantes et de la clé API lue en base
+CACHE_TTL = int(os.getenv('MESSAGEPRO_CACHE_TTL', '300'))
+SECRET_TTL = int(os.getenv('MESSAGEPRO_SECRET_TTL', '300'))
+
+# Endpoints mis en cache (comptes WhatsApp, groupes, tarifs, appareils)
+CACHED_ENDPOINTS = ('get/wa.accounts', 'get/groups', 'get/rates', 'get/devices')
+# Écritures qui invalident une lecture en cache
+INVALIDATES = {'create/group': 'get/groups', 'delete/group': 'get/groups'}
+
+_session = None
+_session_lock = threading.Lock()
+_concurrency = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_cache = {}  # (empreinte de la clé, endpoint, paramètres) -> (expiration, réponse)
+_cache_lock = threading.Lock()
+_secret = {'value': None, 'expires': 0.0}
+_metrics = {}  # endpoint -> compteurs
+_metrics_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Session HTTP partagée par tous les clients du processus"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=RETRIES, connect=RETRIES, read=RETRIES, status=RETRIES,
+                    backoff_factor=RETRY_BACKOFF,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(['GET']),
+                    respect_retry_after_header=True,
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE,
+                                      max_retries=retry, pool_block=True)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def reset_session():
+    """Ferme le pool (après fork, ou en test pour changer de configuration)"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def _cached_secret() -> Optional[str]:
+    """Clé API : base de données (mise en cache SECRET_TTL) puis MESSAGEPRO_API_SECRET"""
+    now = time.monotonic()
+    if _secret['value'] and now < _secret['expires']:
+        return _secret['value']
+    secret = None
+    try:
+        from models import ApiConfig
+        secret = ApiConfig.get_api_secret('messagepro')
+    except Exception:
+        secret = None
+    secret = secret or os.getenv('MESSAGEPRO_API_SECRET')
+    _secret.update(value=secret, expires=now + SECRET_TTL)
+    return secret
+
+
+def clear_cache(endpoint: Optional[str] = None, secret: bool = False):
+    """Vide le cache des réponses (d'un endpoint ou complet) et, si demandé, la clé API"""
+    with _cache_lock:
+        for key in [key for key in _cache if endpoint is None or key[1] == endpoint]:
+            del _cache[key]
+    if secret:
+        _secret.update(value=None, expires=0.0)
+
+
+def _record(endpoint: str, elapsed: float, error: bool = False, cache_hit: bool = False):
+    with _metrics_lock:
+        stats = _metrics.setdefault(endpoint, {
+            'calls': 0, 'errors': 0, 'cache_hits': 0, 'total_ms': 0.0, 'max_ms': 0.0
+        })
+        if cache_hit:
+            stats['cache_hits'] += 1
+            return
+        elapsed_ms = elapsed * 1000
+        stats['calls'] += 1
+        stats['errors'] += 1 if error else 0
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+
+def get_metrics() -> Dict[str, Dict[str, Any]]:
+    """Latence et erreurs par endpoint depuis le démarrage du processus"""
+    with _metrics_lock:
+        return {
+            endpoint: dict(
+                stats,
+                total_ms=round(stats['total_ms'], 1),
+                max_ms=round(stats['max_ms'], 1),
+                avg_ms=round(stats['total_ms'] / stats['calls'], 1) if stats['calls'] else 0.0
+            )
+            for endpoint, stats in sorted(_metrics.items())
+        }
+
+
+def reset_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
 
 class MessageProAPI:
     """Client API pour Message Pro"""
     
-    BASE_URL = "https://messagepro-gn.com/api"
+    BASE_URL = os.getenv('MESSAGEPRO_BASE_URL', "https://messagepro-gn.com/api")
     
     def __init__(self, api_secret: Optional[str] = None):
         """
         Initialise le client API Message Pro
         
+        Le client est léger : la session HTTP, le cache et la clé lue en base
+        sont partagés au niveau du module.
+        
         Args:
             api_secret: Clé secrète API (si None, lit depuis la DB puis MESSAGEPRO_API_SECRET)
         """
-        if api_secret:
-            self.api_secret = api_secret
-        else:
-            # Essayer de récupérer depuis la base de données
-            try:
-                from models import ApiConfig
-                self.api_secret = ApiConfig.get_api_secret('messagepro')
-            except Exception:
-                self.api_secret = None
-            
-            # Si pas trouvé dans la DB, utiliser la variable d'environnement
-            if not self.api_secret:
-                self.api_secret = os.getenv('MESSAGEPRO_API_SECRET')
+        self.api_secret = api_secret or _cached_secret()
         
         if not self.api_secret:
             raise ValueError("MESSAGEPRO_API_SECRET doit être défini dans la base de données ou les variables d'environnement")
     
+    def _cache_key(self, endpoint: str, params: Dict) -> tuple:
+        fingerprint = hashlib.sha256(self.api_secret.encode('utf-8')).hexdigest()[:16]
+        return (fingerprint, endpoint, tuple(sorted((k, str(v)) for k, v in params.items())))
+    
     def _make_request(self, method: str, endpoint: str, params: Optional[Dict] = None, 
                      data: Optional[Dict] = None, files: Optional[Dict] = None) -> Dict[str, Any]:
         """
@@ -58,38 +184,55 @@ class MessageProAPI:
         url = f"{self.BASE_URL}/{endpoint}"
         
         # Ajouter le secret aux paramètres ou données
-        if params is None:
-            params = {}
-        if data is None:
-            data = {}
+        params = dict(params or {})
+        data = dict(data or {})
+        
+        cache_key = None
+        if method == 'GET' and endpoint in CACHED_ENDPOINTS and CACHE_TTL > 0:
+            cache_key = self._cache_key(endpoint, params)
+            with _cache_lock:
+                cached = _cache.get(cache_key)
+            if cached and cached[0] > time.monotonic():
+                _record(endpoint, 0, cache_hit=True)
+                return copy.deepcopy(cached[1])
         
         if method == 'GET':
             params['secret'] = self.api_secret
         else:
-            if files:
-                data['secret'] = self.api_secret
-            else:
-                data['secret'] = self.api_secret
+            data['secret'] = self.api_secret
         
+        started = time.perf_counter()
+        error = True
         try:
-            if method == 'GET':
-                response = requests.get(url, params=params, timeout=30)
-            elif method == 'POST':
-                if files:
-                    response = requests.post(url, data=data, files=files, timeout=30)
+            with _concurrency:
+                if method == 'GET':
+                    response = get_session().get(url, params=params, timeout=TIMEOUT)
+                elif method == 'POST':
+                    if files:
+                        response = get_session().post(url, data=data, files=files, timeout=TIMEOUT)
+                    else:
+                        response = get_session().post(url, data=data, timeout=TIMEOUT)
                 else:
-                    response = requests.post(url, data=data, timeout=30)
-            else:
-                raise ValueError(f"Méthode HTTP non supportée: {method}")
+                    raise ValueError(f"Méthode HTTP non supportée: {method}")
             
             response.raise_for_status()
-            return response.json()
+            result = response.json()
+            error = not isinstance(result, dict) or result.get('status') != 200
         except requests.exceptions.RequestException as e:
             return {
                 'status': 500,
                 'message': f'Erreur lors de la requête API: {str(e)}',
                 'data': None
             }
+        finally:
+            _record(endpoint, time.perf_counter() - started, error=error)
+        
+        if cache_key is not None and not error:
+            with _cache_lock:
+                _cache[cache_key] = (time.monotonic() + CACHE_TTL, copy.deepcopy(result))
+        if endpoint in INVALIDATES and not error:
+            clear_cache(INVALIDATES[endpoint])
+        return result
     
     # =========================================================
     # ACCOUNT APIs
@@ -9,12 +9,47 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from datetime import datetime
 from messagepro_api import MessageProAPI
+import messagepro_api
 from auth import has_permission
+from models import db
+import hashlib
 import os
+import job_queue
 
 # Créer le blueprint
 messaging_bp = Blueprint('messaging', __name__, url_prefix='/messaging')
 
+# =========================================================
+# TÂCHES DE LA FILE (ENVOIS HORS REQUÊTE)
+# =========================================================
+
+def _send_key(kind, *parts):
+    """Clé d'idempotence d'un envoi : même utilisateur, même contenu, même minute = un seul envoi"""
+    digest = hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32]
+    return f"messaging:{kind}:{current_user.id}:{datetime.now().strftime('%Y%m%d%H%M')}:{digest}"
+
+
+def _check_result(result):
+    """Une réponse non 200 lève une exception : la tâche sera retentée"""
+    if result.get('status') != 200:
+        raise RuntimeError(result.get('message', 'Erreur inconnue'))
+    return {'message_id': result.get('data', {}).get('messageId')}
+
+
+@job_queue.task('messaging.send_sms', queue='messaging')
+def task_send_sms(**kwargs):
+    return _check_result(MessageProAPI().send_sms(**kwargs))
+
+
+@job_queue.task('messaging.send_bulk_sms', queue='messaging')
+def task_send_bulk_sms(**kwargs):
+    return _check_result(MessageProAPI().send_bulk_sms(**kwargs))
+
+
+@job_queue.task('messaging.send_whatsapp_text', queue='messaging')
+def task_send_whatsapp_text(**kwargs):
+    return _check_result(MessageProAPI().send_whatsapp(**kwargs))
+
 # =========================================================
 # ROUTES - DASHBOARD
 # =========================================================
@@ -86,21 +121,18 @@ def send_sms():
             if not phone or not message:
                 flash('Le numéro et le message sont obligatoires', 'error')
             else:
-                result = api.send_sms(
-                    phone=phone,
-                    message=message,
-                    mode=mode,
-                    device=device,
-                    gateway=gateway,
-                    sim=sim,
-                    priority=priority
-                )
-                
-                if result.get('status') == 200:
-                    flash(f"SMS envoyé avec succès! ID: {result.get('data', {}).get('messageId', 'N/A')}", 'success')
-                    return redirect(url_for('messaging.send_sms'))
-                else:
-                    flash(f"Erreur: {result.get('message', 'Erreur inconnue')}", 'error')
+                job_id = job_queue.enqueue('messaging.send_sms', {
+                    'phone': phone,
+                    'message': message,
+                    'mode': mode,
+                    'device': device,
+                    'gateway': gateway,
+                    'sim': sim,
+                    'priority': priority
+                }, idempotency_key=_send_key('sms', phone, message))
+                db.session.commit()
+                flash(f"Envoi du SMS programmé (tâche {job_id})", 'success')
+                return redirect(url_for('messaging.send_sms'))
         
         # Récupérer les appareils et gateways pour le formulaire
         devices = api.get_devices(limit=100)
@@ -146,23 +178,20 @@ def send_bulk_sms():
             elif not numbers and not groups:
                 flash('Vous devez spécifier des numéros ou des groupes', 'error')
             else:
-                result = api.send_bulk_sms(
-                    campaign=campaign,
-                    message=message,
-                    mode=mode,
-                    numbers=numbers,
-                    groups=groups,
-                    device=device,
-                    gateway=gateway,
-                    sim=sim,
-                    priority=priority
-                )
-                
-                if result.get('status') == 200:
-                    flash(f"Campagne SMS créée avec succès! ID: {result.get('data', {}).get('messageId', 'N/A')}", 'success')
-                    return redirect(url_for('messaging.send_bulk_sms'))
-                else:
-                    flash(f"Erreur: {result.get('message', 'Erreur inconnue')}", 'error')
+                job_id = job_queue.enqueue('messaging.send_bulk_sms', {
+                    'campaign': campaign,
+                    'message': message,
+                    'mode': mode,
+                    'numbers': numbers,
+                    'groups': groups,
+                    'device': device,
+                    'gateway': gateway,
+                    'sim': sim,
+                    'priority': priority
+                }, idempotency_key=_send_key('bulk', campaign, numbers, groups, message))
+                db.session.commit()
+                flash(f"Campagne SMS programmée (tâche {job_id})", 'success')
+                return redirect(url_for('messaging.send_bulk_sms'))
         
         # Récupérer les données pour le formulaire
         devices = api.get_devices(limit=100)
@@ -246,6 +275,20 @@ def send_whatsapp():
                     if doc_file.filename:
                         files = {'document_file': (doc_file.filename, doc_file.stream, doc_file.content_type)}
                 
+                if not files:
+                    # Message sans pièce jointe : envoyé par la file
+                    job_id = job_queue.enqueue('messaging.send_whatsapp_text', {
+                        'account': account,
+                        'recipient': recipient,
+                        'message': message,
+                        'message_type': message_type,
+                        'priority': priority
+                    }, idempotency_key=_send_key('whatsapp', account, recipient, message_type, message))
+                    db.session.commit()
+                    flash(f"Envoi du message WhatsApp programmé (tâche {job_id})", 'success')
+                    return redirect(url_for('messaging.send_whatsapp'))
+                
+                # Pièce jointe (flux du fichier téléversé) : envoi immédiat
                 result = api.send_whatsapp(
                     account=account,
                     recipient=recipient,
@@ -539,6 +582,20 @@ def api_verify_otp():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@messaging_bp.route('/api/metrics')
+@login_required
+def api_metrics():
+    """API JSON : latence, erreurs et cache des appels Message Pro de ce processus"""
+    if not has_permission(current_user, 'messaging.read'):
+        return jsonify({'error': 'Permission refusée'}), 403
+    
+    return jsonify({
+        'endpoints': messagepro_api.get_metrics(),
+        'pool_size': messagepro_api.POOL_SIZE,
+        'max_concurrency': messagepro_api.MAX_CONCURRENCY,
+        'cache_ttl': messagepro_api.CACHE_TTL
+    })
+
 # =========================================================
 # ROUTES - CONFIGURATION API
 # =========================================================
@@ -602,6 +659,7 @@ def api_config():
                         # Enregistrer la clé
                         ApiConfig.set_api_secret('messagepro', new_api_secret, current_user.id)
                         db.session.commit()
+                        messagepro_api.clear_cache(secret=True)
                         flash('Clé API enregistrée avec succès!', 'success')
                         return redirect(url_for('messaging.api_config'))
                     else:
@@ -614,6 +672,7 @@ def api_config():
                 config.api_secret = None
                 config.updated_by_id = current_user.id
                 db.session.commit()
+                messagepro_api.clear_cache(secret=True)
                 flash('Configuration supprimée', 'success')
                 return redirect(url_for('messaging.api_config'))
     
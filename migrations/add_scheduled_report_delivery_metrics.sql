@@ -0,0 +1,55 @@
+-- Migration: Métriques d'envoi des rapports planifiés
+-- Date: 2026-10-18
+-- Description: Durée, nombre d'envois réussis et en échec de la dernière exécution d'un rapport
+
+SET @col_duration_exists = (
+    SELECT COUNT(*) 
+    FROM INFORMATION_SCHEMA.COLUMNS 
+    WHERE TABLE_SCHEMA = DATABASE() 
+    AND TABLE_NAME = 'scheduled_reports' 
+    AND COLUMN_NAME = 'last_duration_ms'
+);
+
+SET @col_sent_exists = (
+    SELECT COUNT(*) 
+    FROM INFORMATION_SCHEMA.COLUMNS 
+    WHERE TABLE_SCHEMA = DATABASE() 
+    AND TABLE_NAME = 'scheduled_reports' 
+    AND COLUMN_NAME = 'last_sent_count'
+);
+
+SET @col_failed_exists = (
+    SELECT COUNT(*) 
+    FROM INFORMATION_SCHEMA.COLUMNS 
+    WHERE TABLE_SCHEMA = DATABASE() 
+    AND TABLE_NAME = 'scheduled_reports' 
+    AND COLUMN_NAME = 'last_failed_count'
+);
+
+SET @sql_duration = IF(@col_duration_exists = 0,
+    'ALTER TABLE `scheduled_reports` ADD COLUMN `last_duration_ms` INT NULL AFTER `last_error`',
+    'SELECT "Colonne last_duration_ms existe déjà" AS message');
+PREPARE stmt FROM @sql_duration;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @sql_sent = IF(@col_sent_exists = 0,
+    'ALTER TABLE `scheduled_reports` ADD COLUMN `last_sent_count` INT NULL AFTER `last_duration_ms`',
+    'SELECT "Colonne last_sent_count existe déjà" AS message');
+PREPARE stmt FROM @sql_sent;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @sql_failed = IF(@col_failed_exists = 0,
+    'ALTER TABLE `scheduled_reports` ADD COLUMN `last_failed_count` INT NULL AFTER `last_sent_count`',
+    'SELECT "Colonne last_failed_count existe déjà" AS message');
+PREPARE stmt FROM @sql_failed;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- PostgreSQL :
+-- ALTER TABLE scheduled_reports ADD COLUMN IF NOT EXISTS last_duration_ms INTEGER NULL;
+-- ALTER TABLE scheduled_reports ADD COLUMN IF NOT EXISTS last_sent_count INTEGER NULL;
+-- ALTER TABLE scheduled_reports ADD COLUMN IF NOT EXISTS last_failed_count INTEGER NULL;
+
+SELECT 'Migration terminée avec succès' AS result;
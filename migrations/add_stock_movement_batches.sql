@@ -0,0 +1,69 @@
+-- Migration: Bons de mouvement (en-têtes des transferts multi-articles)
+-- Date: 2026-10-18
+-- Description: Table stock_movement_batches, colonne stock_movements.batch_id et rattachement
+-- des mouvements existants par référence de base (TRANS-...-1-OUT / -IN / -OUT-2 -> TRANS-...-1)
+-- (alternative portable au rattachement SQL : scripts/backfill_movement_batches.py,
+-- également exécuté au démarrage de l'application quand la table est vide)
+
+CREATE TABLE IF NOT EXISTS `stock_movement_batches` (
+  `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+  `reference` VARCHAR(50) NOT NULL,
+  `movement_type` VARCHAR(20) NOT NULL,
+  `movement_date` DATETIME NOT NULL,
+  `user_id` BIGINT UNSIGNED NULL,
+  `from_depot_id` BIGINT UNSIGNED NULL,
+  `from_vehicle_id` BIGINT UNSIGNED NULL,
+  `to_depot_id` BIGINT UNSIGNED NULL,
+  `to_vehicle_id` BIGINT UNSIGNED NULL,
+  `lines_count` INT NOT NULL DEFAULT 0,
+  `items_count` INT NOT NULL DEFAULT 0,
+  `created_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `ix_stock_movement_batches_reference` (`reference`),
+  KEY `idx_movement_batch_date` (`movement_date`),
+  KEY `idx_movement_batch_items` (`items_count`),
+  CONSTRAINT `fk_movement_batch_user` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE SET NULL ON UPDATE CASCADE,
+  CONSTRAINT `fk_movement_batch_from_depot` FOREIGN KEY (`from_depot_id`) REFERENCES `depots` (`id`) ON DELETE SET NULL ON UPDATE CASCADE,
+  CONSTRAINT `fk_movement_batch_from_vehicle` FOREIGN KEY (`from_vehicle_id`) REFERENCES `vehicles` (`id`) ON DELETE SET NULL ON UPDATE CASCADE,
+  CONSTRAINT `fk_movement_batch_to_depot` FOREIGN KEY (`to_depot_id`) REFERENCES `depots` (`id`) ON DELETE SET NULL ON UPDATE CASCADE,
+  CONSTRAINT `fk_movement_batch_to_vehicle` FOREIGN KEY (`to_vehicle_id`) REFERENCES `vehicles` (`id`) ON DELETE SET NULL ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+SET @col_batch_exists = (
+    SELECT COUNT(*)
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+    AND TABLE_NAME = 'stock_movements'
+    AND COLUMN_NAME = 'batch_id'
+);
+
+SET @sql_batch = IF(@col_batch_exists = 0,
+    'ALTER TABLE `stock_movements` ADD COLUMN `batch_id` BIGINT UNSIGNED NULL AFTER `inventory_session_id`, ADD INDEX `ix_stock_movements_batch_id` (`batch_id`), ADD CONSTRAINT `fk_movement_batch` FOREIGN KEY (`batch_id`) REFERENCES `stock_movement_batches` (`id`) ON DELETE SET NULL ON UPDATE CASCADE',
+    'SELECT "Colonne batch_id existe déjà" AS message');
+PREPARE stmt FROM @sql_batch;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- Rattachement des mouvements existants (MySQL 8 : REGEXP_REPLACE)
+INSERT IGNORE INTO `stock_movement_batches`
+    (`reference`, `movement_type`, `movement_date`, `user_id`, `from_depot_id`, `from_vehicle_id`,
+     `to_depot_id`, `to_vehicle_id`, `lines_count`, `items_count`, `created_at`)
+SELECT REGEXP_REPLACE(`reference`, '-(OUT|IN)(-[0-9]+)?$', '') AS base_reference,
+       MIN(`movement_type`), MIN(`movement_date`), MIN(`user_id`), MAX(`from_depot_id`), MAX(`from_vehicle_id`),
+       MAX(`to_depot_id`), MAX(`to_vehicle_id`), COUNT(*), COUNT(DISTINCT `stock_item_id`), NOW()
+FROM `stock_movements`
+WHERE `reference` IS NOT NULL AND `batch_id` IS NULL
+GROUP BY base_reference;
+
+UPDATE `stock_movements` m
+JOIN `stock_movement_batches` b ON b.`reference` = REGEXP_REPLACE(m.`reference`, '-(OUT|IN)(-[0-9]+)?$', '')
+SET m.`batch_id` = b.`id`
+WHERE m.`reference` IS NOT NULL AND m.`batch_id` IS NULL;
+
+-- PostgreSQL :
+-- (table créée par db.create_all)
+-- ALTER TABLE stock_movements ADD COLUMN IF NOT EXISTS batch_id BIGINT NULL REFERENCES stock_movement_batches (id) ON DELETE SET NULL ON UPDATE CASCADE;
+-- CREATE INDEX IF NOT EXISTS ix_stock_movements_batch_id ON stock_movements (batch_id);
+-- puis : python scripts/backfill_movement_batches.py
+
+SELECT 'Migration terminée avec succès' AS result;
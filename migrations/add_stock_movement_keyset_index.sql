@@ -0,0 +1,25 @@
+-- Migration: Pagination par curseur de la liste des mouvements de stock
+-- Date: 2026-10-18
+-- Description: Index composite (movement_date, id) pour parcourir les mouvements par curseur
+-- (la table d'agrégats stock_movement_daily_counts est créée par db.create_all et
+-- initialisée au démarrage, ou par scripts/rebuild_stock_ledger.py --force)
+
+SET @idx_exists = (
+    SELECT COUNT(*) 
+    FROM INFORMATION_SCHEMA.STATISTICS 
+    WHERE TABLE_SCHEMA = DATABASE() 
+    AND TABLE_NAME = 'stock_movements' 
+    AND INDEX_NAME = 'idx_movement_date_id'
+);
+
+SET @sql_idx = IF(@idx_exists = 0,
+    'CREATE INDEX `idx_movement_date_id` ON `stock_movements` (`movement_date`, `id`)',
+    'SELECT "Index idx_movement_date_id existe déjà" AS message');
+PREPARE stmt FROM @sql_idx;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- PostgreSQL :
+-- CREATE INDEX IF NOT EXISTS idx_movement_date_id ON stock_movements (movement_date, id);
+
+SELECT 'Migration terminée avec succès' AS result;
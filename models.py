@@ -18,7 +18,8 @@ N18_2 = db.Numeric(18, 2)
 N18_4 = db.Numeric(18, 4)
 
 # BIGINT UNSIGNED côté MySQL, BigInteger générique ailleurs
-BIGINT_U = db.BigInteger().with_variant(mysql.BIGINT(unsigned=True), "mysql")
+# SQLite : INTEGER pour que les clés primaires soient auto-incrémentées (alias de rowid)
+BIGINT_U = db.BigInteger().with_variant(mysql.BIGINT(unsigned=True), "mysql").with_variant(db.Integer(), "sqlite")
 
 # Helper pour PK & FK
 def PK():
@@ -700,6 +701,40 @@ class VehicleStock(db.Model):
     def __repr__(self):
         return f"<VehicleStock vehicle={self.vehicle_id} item={self.stock_item_id} qty={self.quantity}>"
 
+class StockMovementBatch(db.Model):
+    """
+    En-tête d'un bon de mouvement (transfert multi-articles, chargement...)
+    Regroupe les lignes StockMovement qui partagent une référence de base
+    (TRANS-20250110-1-OUT, TRANS-20250110-1-IN-2...) ; tenu à jour par movement_batches.py
+    """
+    __tablename__ = "stock_movement_batches"
+    id = PK()
+    reference = db.Column(db.String(50), nullable=False, unique=True, index=True)
+    movement_type = db.Column(db.String(20), nullable=False)
+    movement_date = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    user_id = FK("users.id", onupdate="CASCADE", ondelete="SET NULL")
+    from_depot_id = FK("depots.id", nullable=True, onupdate="CASCADE", ondelete="SET NULL")
+    from_vehicle_id = FK("vehicles.id", nullable=True, onupdate="CASCADE", ondelete="SET NULL")
+    to_depot_id = FK("depots.id", nullable=True, onupdate="CASCADE", ondelete="SET NULL")
+    to_vehicle_id = FK("vehicles.id", nullable=True, onupdate="CASCADE", ondelete="SET NULL")
+    lines_count = db.Column(db.Integer, nullable=False, default=0)  # mouvements du bon
+    items_count = db.Column(db.Integer, nullable=False, default=0)  # articles distincts
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    
+    user = db.relationship("User", lazy="select")
+    from_depot = db.relationship("Depot", foreign_keys=[from_depot_id], lazy="select")
+    from_vehicle = db.relationship("Vehicle", foreign_keys=[from_vehicle_id], lazy="select")
+    to_depot = db.relationship("Depot", foreign_keys=[to_depot_id], lazy="select")
+    to_vehicle = db.relationship("Vehicle", foreign_keys=[to_vehicle_id], lazy="select")
+    
+    __table_args__ = (
+        db.Index("idx_movement_batch_date", "movement_date"),
+        db.Index("idx_movement_batch_items", "items_count"),
+    )
+    
+    def __repr__(self):
+        return f"<StockMovementBatch {self.reference} lines={self.lines_count} items={self.items_count}>"
+
 class StockMovement(db.Model):
     __tablename__ = "stock_movements"
     id = PK()
@@ -726,12 +761,17 @@ class StockMovement(db.Model):
     reason = db.Column(db.Text, nullable=True)
     inventory_session_id = FK("inventory_sessions.id", nullable=True, onupdate="CASCADE", ondelete="SET NULL")
     
+    # Bon de mouvement (lignes d'un même transfert)
+    batch_id = FK("stock_movement_batches.id", nullable=True, index=True, onupdate="CASCADE", ondelete="SET NULL")
+    
     created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
     
     inventory_session = db.relationship("InventorySession", backref="movements", lazy="select")
+    batch = db.relationship("StockMovementBatch", backref=db.backref("movements", lazy="select", order_by="StockMovement.id"), lazy="select")
     
     __table_args__ = (
         db.Index("idx_movement_date", "movement_date"),
+        db.Index("idx_movement_date_id", "movement_date", "id"),  # pagination par curseur (date, id)
         db.Index("idx_movement_type", "movement_type"),
         db.Index("idx_movement_item", "stock_item_id"),
         db.Index("idx_movement_user", "user_id"),
@@ -740,6 +780,46 @@ class StockMovement(db.Model):
     def __repr__(self):
         return f"<StockMovement {self.movement_type} item={self.stock_item_id} qty={self.quantity}>"
 
+class StockBalanceLedger(db.Model):
+    """
+    Grand livre matérialisé des soldes de stock, alimenté par stock_ledger.py
+    Une ligne par (emplacement, article, type de mouvement, jour) :
+    - quantity_in : entrées (mouvements dont l'emplacement est la destination)
+    - quantity_out : sorties en valeur absolue (mouvements dont l'emplacement est la source)
+    """
+    __tablename__ = "stock_balance_ledger"
+    # Clé primaire composite = clé d'agrégation (upsert additif sans identifiant technique)
+    location_type = db.Column(db.String(10), primary_key=True)  # 'depot' ou 'vehicle'
+    location_id = db.Column(BIGINT_U, primary_key=True)
+    stock_item_id = FK("stock_items.id", nullable=False, primary_key=True, onupdate="CASCADE", ondelete="CASCADE")
+    movement_type = db.Column(db.String(20), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    quantity_in = db.Column(N18_4, nullable=False, default=Decimal("0.0000"))
+    quantity_out = db.Column(N18_4, nullable=False, default=Decimal("0.0000"))
+    movements_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("idx_ledger_location", "location_type", "location_id"),
+        db.Index("idx_ledger_item_day", "stock_item_id", "day"),
+        db.Index("idx_ledger_day", "day"),
+    )
+
+    def __repr__(self):
+        return f"<StockBalanceLedger {self.location_type}={self.location_id} item={self.stock_item_id} {self.day} in={self.quantity_in} out={self.quantity_out}>"
+
+class StockMovementDailyCount(db.Model):
+    """
+    Nombre de mouvements de stock par (jour, type), alimenté par stock_ledger.py
+    Sert aux compteurs par type et à la tendance journalière de la liste des mouvements
+    """
+    __tablename__ = "stock_movement_daily_counts"
+    day = db.Column(db.Date, primary_key=True)
+    movement_type = db.Column(db.String(20), primary_key=True)
+    movements_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<StockMovementDailyCount {self.day} {self.movement_type}={self.movements_count}>"
+
 class Reception(db.Model):
     __tablename__ = "receptions"
     id = PK()
@@ -1602,6 +1682,97 @@ class SearchIndex(db.Model):
     def __repr__(self):
         return f"<SearchIndex {self.entity_type}:{self.entity_id} - {self.title[:50]}>"
 
+class SearchReindexJob(db.Model):
+    """Réindexation complète de la recherche, par lots et reprenable (search_indexer.py)"""
+    __tablename__ = "search_reindex_jobs"
+    id = PK()
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)  # pending, running, completed, failed, cancelled
+    entity_types = db.Column(db.JSON, nullable=False)  # Types à indexer, dans l'ordre
+    # Point de reprise : dernier identifiant indexé du type en cours (pagination par clé)
+    current_entity_type = db.Column(db.String(50), nullable=True)
+    last_entity_id = db.Column(BIGINT_U, nullable=False, default=0)
+    processed = db.Column(db.JSON, nullable=True)  # {type: nombre d'entités traitées}
+    totals = db.Column(db.JSON, nullable=True)  # {type: nombre d'entités au lancement}
+    chunks_done = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    worker = db.Column(db.String(100), nullable=True)  # tâche job_queue responsable (job_queue:<id>) ou hôte:pid d'une exécution directe
+    requested_by_id = FK("users.id", nullable=True, onupdate="CASCADE", ondelete="SET NULL")
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC), index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<SearchReindexJob {self.id} {self.status}>"
+
+class InventoryValidationJob(db.Model):
+    """Validation d'une session d'inventaire exécutée hors requête HTTP (inventory_validation.py)"""
+    __tablename__ = "inventory_validation_jobs"
+    id = PK()
+    session_id = FK("inventory_sessions.id", onupdate="CASCADE", ondelete="CASCADE")
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)  # pending, running, completed, failed
+    total_lines = db.Column(db.Integer, nullable=False, default=0)  # Lignes de comptage de la session
+    adjustments = db.Column(db.Integer, nullable=False, default=0)  # Mouvements d'ajustement à écrire / écrits
+    error = db.Column(db.Text, nullable=True)
+    worker = db.Column(db.String(100), nullable=True)  # tâche job_queue responsable (job_queue:<id>) ou hôte:pid d'une exécution directe
+    requested_by_id = FK("users.id", nullable=True, onupdate="CASCADE", ondelete="SET NULL")
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC), index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<InventoryValidationJob {self.id} session={self.session_id} {self.status}>"
+
+class BackgroundJob(db.Model):
+    """Tâche de la file durable (job_queue.py) : notifications, SMS/WhatsApp, rapports"""
+    __tablename__ = "background_jobs"
+    id = PK()
+    queue = db.Column(db.String(50), nullable=False, default="default")
+    task = db.Column(db.String(100), nullable=False)  # Nom enregistré via @job_queue.task
+    payload = db.Column(db.JSON, nullable=True)  # Arguments nommés de la tâche (identifiants, pas d'objets)
+    idempotency_key = db.Column(db.String(191), nullable=True, unique=True)  # Même clé = même tâche
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, running, succeeded, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_after = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))  # Prochaine tentative (backoff)
+    last_error = db.Column(db.Text, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    locked_by = db.Column(db.String(100), nullable=True)  # hôte:pid du worker qui exécute la tâche
+    locked_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC), index=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("idx_background_jobs_ready", "status", "run_after"),
+        db.Index("idx_background_jobs_queue", "queue", "status"),
+    )
+
+    def __repr__(self):
+        return f"<BackgroundJob {self.id} {self.task} {self.status}>"
+
+class SchedulerLease(db.Model):
+    """Bail de leader : un seul processus du cluster exécute les tâches planifiées (scheduled_reports.py)"""
+    __tablename__ = "scheduler_leases"
+    name = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(255), nullable=False)  # hôte:pid:jeton du processus leader
+    acquired_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    expires_at = db.Column(db.DateTime, nullable=False)  # Sans renouvellement avant cette date, le bail est libre
+
+    def __repr__(self):
+        return f"<SchedulerLease {self.name} {self.holder}>"
+
+class DocumentSequence(db.Model):
+    """Compteur de références de documents par préfixe et par jour (reference_sequences.py)"""
+    __tablename__ = "document_sequences"
+    prefix = db.Column(db.String(20), primary_key=True)  # CMD, TRANS, REC, ENL, RET, APP...
+    day = db.Column(db.Date, primary_key=True)
+    last_value = db.Column(db.Integer, nullable=False, default=0)  # Dernier numéro attribué
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
+
+    def __repr__(self):
+        return f"<DocumentSequence {self.prefix} {self.day} {self.last_value}>"
+
 # =========================================================
 # ÉQUIPE DE PROMOTION - HOUSE TO HOUSE
 # =========================================================
@@ -2277,6 +2448,10 @@ class ScheduledReport(db.Model):
     next_run = db.Column(db.DateTime, nullable=True)
     run_count = db.Column(db.Integer, nullable=False, default=0)
     last_error = db.Column(db.Text, nullable=True)
+    # Métriques du dernier envoi (durée totale, destinataires servis / en échec)
+    last_duration_ms = db.Column(db.Integer, nullable=True)
+    last_sent_count = db.Column(db.Integer, nullable=True)
+    last_failed_count = db.Column(db.Integer, nullable=True)
     
     # Métadonnées
     created_by_id = FK("users.id", nullable=False, onupdate="CASCADE", ondelete="RESTRICT")
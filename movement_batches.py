@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bons de mouvement (stock_movement_batches)
+
+Un transfert multi-articles est stocké en lignes StockMovement dont les
+références partagent une base (TRANS-20250110-1-OUT, TRANS-20250110-1-IN,
+TRANS-20250110-1-OUT-2...). Chaque ligne pointe vers l'en-tête de son bon
+(batch_id) : source, destination, date, utilisateur, nombre de lignes et
+d'articles. Liste, filtre par nombre d'articles et détail d'un bon sont des
+requêtes SQL indexées au lieu d'un regroupement Python par analyse de chaînes.
+
+Rattachement :
+- écritures ORM : listener before_flush (lignes nouvelles sans bon) ;
+- insertions groupées : stock_mutations.record_movements() appelle
+  assign_batches() puis refresh_batches() ;
+- données existantes : backfill_batches() (démarrage ou
+  scripts/backfill_movement_batches.py).
+
+Les compteurs d'un bon sont recalculés en SQL après chaque flush qui touche
+une de ses lignes ; un bon sans ligne est supprimé.
+"""
+
+import re
+from datetime import datetime, UTC
+
+from sqlalchemy import event, exists, func, insert, select, update, delete, bindparam
+from sqlalchemy.orm import Session, object_session
+
+from models import db, StockMovement, StockMovementBatch
+
+# Suffixes des lignes d'un bon : -OUT, -IN, -OUT-2, -IN-3...
+LINE_SUFFIX = re.compile(r'-(OUT|IN)(-\d+)?$')
+
+# Colonnes d'en-tête reprises de la première ligne qui les renseigne
+LOCATION_FIELDS = ('from_depot_id', 'from_vehicle_id', 'to_depot_id', 'to_vehicle_id')
+
+CHUNK_SIZE = 500
+
+
+def base_reference(reference):
+    """
+    Référence du bon d'une ligne (sans -OUT, -IN et leurs variantes numérotées)
+    TRANS-20250110-1-OUT-2 -> TRANS-20250110-1, REC-20250110-1 -> REC-20250110-1
+    """
+    if not reference:
+        return None
+    return LINE_SUFFIX.sub('', reference)
+
+
+def line_reference(base, direction, line_number=1):
+    """Référence de la ligne n d'un bon : BASE-OUT, BASE-IN-2..."""
+    suffix = f"{base}-{direction}"
+    return suffix if line_number == 1 else f"{suffix}-{line_number}"
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _get(row, name):
+    return row.get(name) if isinstance(row, dict) else getattr(row, name, None)
+
+
+def _header(reference, rows):
+    """Valeurs d'en-tête d'un bon depuis ses lignes"""
+    dates = [_get(row, 'movement_date') for row in rows if _get(row, 'movement_date') is not None]
+    values = {
+        'reference': reference,
+        'movement_type': _get(rows[0], 'movement_type') or 'transfer',
+        'movement_date': min(dates) if dates else None,
+        'user_id': _get(rows[0], 'user_id'),
+        'lines_count': 0,
+        'items_count': 0,
+    }
+    for field in LOCATION_FIELDS:
+        values[field] = next((_get(row, field) for row in rows if _get(row, field)), None)
+    return values
+
+
+def _batch_ids_by_reference(connection, references):
+    table = StockMovementBatch.__table__
+    ids = {}
+    for chunk in _chunks(references):
+        ids.update(connection.execute(
+            select(table.c.reference, table.c.id).where(table.c.reference.in_(chunk))
+        ).all())
+    return ids
+
+
+def assign_batches(connection, rows):
+    """
+    Rattache des lignes (dicts ou objets) à leur bon, créé s'il n'existe pas
+
+    Les lignes sans référence ou déjà rattachées sont ignorées. Pour des dicts,
+    la clé batch_id est renseignée.
+
+    Returns:
+        dict: {index de la ligne dans rows: batch_id}
+    """
+    groups = {}
+    for index, row in enumerate(rows):
+        if _get(row, 'batch_id') is None and _get(row, 'reference'):
+            groups.setdefault(base_reference(_get(row, 'reference')), []).append(index)
+    if not groups:
+        return {}
+
+    ids = _batch_ids_by_reference(connection, groups)
+    missing = [_header(reference, [rows[i] for i in indexes])
+               for reference, indexes in groups.items() if reference not in ids]
+    if missing:
+        now = datetime.now(UTC)
+        for header in missing:
+            header['movement_date'] = header['movement_date'] or now
+            header['created_at'] = now
+        connection.execute(insert(StockMovementBatch.__table__), missing)
+        ids.update(_batch_ids_by_reference(connection, [header['reference'] for header in missing]))
+
+    assigned = {}
+    for reference, indexes in groups.items():
+        for index in indexes:
+            assigned[index] = ids[reference]
+            if isinstance(rows[index], dict):
+                rows[index]['batch_id'] = ids[reference]
+    return assigned
+
+
+def refresh_batches(connection, batch_ids):
+    """
+    Recalcule en SQL les compteurs, la date et les emplacements manquants des bons donnés
+    et supprime les bons qui n'ont plus de ligne
+    """
+    batch_ids = sorted({int(batch_id) for batch_id in batch_ids if batch_id is not None})
+    if not batch_ids:
+        return
+    batches, movements = StockMovementBatch.__table__, StockMovement.__table__
+
+    def lines(*columns):
+        return select(*columns).where(movements.c.batch_id == batches.c.id).scalar_subquery()
+
+    for chunk in _chunks(batch_ids):
+        connection.execute(delete(batches).where(
+            batches.c.id.in_(chunk),
+            ~exists().where(movements.c.batch_id == batches.c.id)
+        ))
+        values = {
+            'lines_count': lines(func.count(movements.c.id)),
+            'items_count': lines(func.count(movements.c.stock_item_id.distinct())),
+            'movement_date': lines(func.min(movements.c.movement_date)),
+        }
+        for field in LOCATION_FIELDS:
+            values[field] = func.coalesce(batches.c[field], lines(func.max(movements.c[field])))
+        connection.execute(update(batches).where(batches.c.id.in_(chunk)).values(**values))
+
+
+def backfill_batches(batch_size=5000):
+    """
+    Rattache à un bon les mouvements existants qui n'en ont pas (par référence de base)
+
+    Returns:
+        int: nombre de mouvements rattachés
+    """
+    table = StockMovement.__table__
+    columns = [table.c.id, table.c.reference, table.c.movement_type, table.c.movement_date,
+               table.c.user_id, table.c.batch_id] + [table.c[field] for field in LOCATION_FIELDS]
+    connection = db.session.connection()
+    touched, total, last_id = set(), 0, 0
+    while True:
+        rows = [dict(row) for row in connection.execute(
+            select(*columns)
+            .where(table.c.batch_id.is_(None), table.c.reference.isnot(None), table.c.id > last_id)
+            .order_by(table.c.id).limit(batch_size)
+        ).mappings()]
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        assign_batches(connection, rows)
+        connection.execute(
+            update(table).where(table.c.id == bindparam('b_id')).values(batch_id=bindparam('b_batch_id')),
+            [{'b_id': row['id'], 'b_batch_id': row['batch_id']} for row in rows]
+        )
+        touched.update(row['batch_id'] for row in rows)
+        total += len(rows)
+    refresh_batches(connection, touched)
+    db.session.commit()
+    return total
+
+
+# =========================================================
+# LISTENERS ORM
+# =========================================================
+
+@event.listens_for(Session, 'before_flush')
+def _assign_new_movements(session, flush_context, instances):
+    """Les nouvelles lignes avec référence sont rattachées à leur bon avant insertion"""
+    pending = [obj for obj in session.new
+               if isinstance(obj, StockMovement) and obj.batch_id is None and obj.batch is None and obj.reference]
+    if not pending:
+        return
+    for index, batch_id in assign_batches(session.connection(), pending).items():
+        pending[index].batch_id = batch_id
+
+
+def _touch(target, *batch_ids):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('movement_batches_touched', set()).update(
+            batch_id for batch_id in batch_ids if batch_id is not None)
+
+
+@event.listens_for(StockMovement, 'after_insert')
+def _batch_after_insert(mapper, connection, target):
+    _touch(target, target.batch_id)
+
+
+@event.listens_for(StockMovement, 'after_update')
+def _batch_after_update(mapper, connection, target):
+    history = db.inspect(target).attrs.batch_id.history
+    _touch(target, target.batch_id, *(history.deleted or ()))
+
+
+@event.listens_for(StockMovement, 'after_delete')
+def _batch_after_delete(mapper, connection, target):
+    _touch(target, target.batch_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_touched_batches(session, flush_context):
+    touched = session.info.pop('movement_batches_touched', None)
+    if touched:
+        refresh_batches(session.connection(), touched)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _reset_touched_batches(session):
+    session.info.pop('movement_batches_touched', None)
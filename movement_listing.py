@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Liste des mouvements de stock : pagination par curseur et facettes précalculées
+
+- Pagination par curseur sur (movement_date, id) : chaque page est une lecture
+  de l'index idx_movement_date_id, sans OFFSET ni COUNT(*) exact
+- Totaux : exacts depuis stock_movement_daily_counts quand aucun filtre n'est
+  appliqué, sinon comptage plafonné (COUNT_CAP) mis en cache quelques secondes
+- Compteurs par type et tendance 30 jours : table journalière (sans restriction
+  régionale) ou requête groupée mise en cache par région
+- Listes des filtres (articles, dépôts, véhicules, utilisateurs) mises en cache
+  par région, invalidées quand un libellé ou un rattachement change
+"""
+
+import base64
+import hashlib
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select
+
+from cache_generations import ChangeTracker, GenerationCache
+from models import db, StockMovement, StockMovementDailyCount, StockItem, Depot, Vehicle, User
+
+MOVEMENT_TYPES = ('transfer', 'reception', 'adjustment', 'inventory')
+TREND_DAYS = 30
+
+# Au-delà, le total affiché est « N+ » (comptage plafonné)
+COUNT_CAP = int(os.getenv('MOVEMENTS_COUNT_CAP', '10000'))
+COUNT_TTL = int(os.getenv('MOVEMENTS_COUNT_TTL', '60'))
+FACETS_TTL = int(os.getenv('MOVEMENTS_FACETS_TTL', '300'))
+FILTER_OPTIONS_TTL = int(os.getenv('MOVEMENTS_FILTER_OPTIONS_TTL', '3600'))
+
+CACHE_PREFIX = 'movement_listing_'
+FILTER_OPTIONS_GENERATION_KEY = 'movement_listing_filters_generation'
+
+# Colonnes affichées dans les listes des filtres (une modification invalide le cache)
+FILTER_OPTION_ATTRIBUTES = {
+    StockItem: ('name', 'sku', 'is_active'),
+    Depot: ('name', 'is_active', 'region_id'),
+    Vehicle: ('plate_number', 'status', 'current_user_id'),
+    User: ('username', 'region_id'),
+}
+
+# Entrées en cache (cache partagé de l'application, sinon mémoire du processus)
+_store = GenerationCache(FILTER_OPTIONS_GENERATION_KEY)
+
+
+# =========================================================
+# CACHE
+# =========================================================
+
+def _cached(key, ttl, loader, generation=None):
+    """Valeur en cache si elle a moins de ttl secondes (et la même génération), sinon loader()"""
+    entry = _store.get(key)
+    if entry and entry['generation'] == generation and time.time() - entry['loaded_at'] < ttl:
+        return entry['value']
+    value = loader()
+    _store.set(key, {'generation': generation, 'loaded_at': time.time(), 'value': value}, timeout=ttl)
+    return value
+
+
+def invalidate_filter_options():
+    """Rend périmées les listes des filtres en cache (tous processus si le cache est partagé)"""
+    _store.invalidate()
+
+
+# Un article, dépôt, véhicule ou utilisateur affiché a changé : nouvelle génération au commit
+_filter_option_changes = ChangeTracker('movement_filters_dirty', invalidate_filter_options,
+                                       'filtres des mouvements', attributes=FILTER_OPTION_ATTRIBUTES)
+
+
+# =========================================================
+# PAGINATION PAR CURSEUR
+# =========================================================
+
+def encode_cursor(movement):
+    """Curseur opaque (URL-safe) désignant la position (movement_date, id) d'un mouvement"""
+    raw = f"{movement.movement_date.isoformat()}|{movement.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(movement_date, id) depuis un curseur, None s'il est absent ou invalide"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        movement_date, movement_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(movement_date), int(movement_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """Page de mouvements (du plus récent au plus ancien) et curseurs des pages voisines"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_page(query, after=None, before=None, per_page=50):
+    """
+    Page de mouvements triés par (movement_date, id) décroissants
+
+    Args:
+        query: requête StockMovement déjà filtrée (sans ORDER BY)
+        after: curseur du dernier mouvement de la page précédente (page suivante)
+        before: curseur du premier mouvement de la page suivante (retour en arrière)
+        per_page: taille de page
+
+    Returns:
+        KeysetPage
+    """
+    date_col, id_col = StockMovement.movement_date, StockMovement.id
+    after_key, before_key = decode_cursor(after), decode_cursor(before)
+
+    if before_key:
+        # Page précédente : lecture ascendante depuis le curseur, puis remise dans l'ordre
+        movement_date, movement_id = before_key
+        rows = query.filter(or_(date_col > movement_date, and_(date_col == movement_date, id_col > movement_id)))\
+                    .order_by(date_col.asc(), id_col.asc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        return KeysetPage(items,
+                          next_cursor=encode_cursor(items[-1]) if items else before,
+                          prev_cursor=encode_cursor(items[0]) if has_prev and items else None)
+
+    if after_key:
+        movement_date, movement_id = after_key
+        query = query.filter(or_(date_col < movement_date, and_(date_col == movement_date, id_col < movement_id)))
+    rows = query.order_by(date_col.desc(), id_col.desc()).limit(per_page + 1).all()
+    items = rows[:per_page]
+    return KeysetPage(items,
+                      next_cursor=encode_cursor(items[-1]) if len(rows) > per_page else None,
+                      prev_cursor=encode_cursor(items[0]) if after_key and items else None)
+
+
+# =========================================================
+# TOTAUX ET FACETTES
+# =========================================================
+
+def _region_key(scope):
+    return scope.region_id if scope.is_restricted else 'all'
+
+
+def _daily_totals_by_type():
+    rows = db.session.query(StockMovementDailyCount.movement_type,
+                            func.sum(StockMovementDailyCount.movements_count))\
+                     .group_by(StockMovementDailyCount.movement_type).all()
+    return {movement_type: int(total or 0) for movement_type, total in rows}
+
+
+def _daily_trend(since):
+    rows = db.session.query(StockMovementDailyCount.day, StockMovementDailyCount.movement_type,
+                            StockMovementDailyCount.movements_count)\
+                     .filter(StockMovementDailyCount.day >= since).all()
+    return [(day, movement_type, count) for day, movement_type, count in rows if count]
+
+
+def _grouped_facets(scope, since):
+    """Compteurs et tendance d'une région par deux requêtes groupées"""
+    from analytics_series import date_trunc, _as_date
+
+    condition = scope.location_condition(
+        (StockMovement.from_depot_id, StockMovement.to_depot_id),
+        (StockMovement.from_vehicle_id, StockMovement.to_vehicle_id)
+    )
+    by_type = dict(db.session.query(StockMovement.movement_type, func.count(StockMovement.id))
+                   .filter(condition).group_by(StockMovement.movement_type).all())
+
+    day = date_trunc(StockMovement.movement_date, 'day')
+    trend = [(_as_date(row_day), movement_type, count)
+             for row_day, movement_type, count in
+             db.session.query(day, StockMovement.movement_type, func.count(StockMovement.id))
+             .filter(condition, StockMovement.movement_date >= datetime.combine(since, datetime.min.time()))
+             .group_by(day, StockMovement.movement_type).all()]
+    return by_type, trend
+
+
+def movement_facets(scope):
+    """
+    Compteurs par type et tendance journalière (TREND_DAYS jours) des mouvements visibles
+
+    Returns:
+        dict: {'total', 'by_type': {type: n}, 'chart_labels', 'chart_<type>'..., 'chart_total'}
+    """
+    since = date.today() - timedelta(days=TREND_DAYS)
+
+    def load():
+        if scope.is_restricted:
+            by_type, trend = _grouped_facets(scope, since)
+        else:
+            by_type, trend = _daily_totals_by_type(), _daily_trend(since)
+
+        by_date = {}
+        for day, movement_type, count in trend:
+            bucket = by_date.setdefault(day.strftime('%Y-%m-%d'), dict.fromkeys(MOVEMENT_TYPES + ('total',), 0))
+            bucket[movement_type] = bucket.get(movement_type, 0) + count
+            bucket['total'] += count
+
+        labels = sorted(by_date)
+        facets = {
+            'total': sum(by_type.values()),
+            'by_type': {movement_type: by_type.get(movement_type, 0) for movement_type in MOVEMENT_TYPES},
+            'chart_labels': labels,
+            'chart_total': [by_date[label]['total'] for label in labels],
+        }
+        for movement_type in MOVEMENT_TYPES:
+            facets[f'chart_{movement_type}'] = [by_date[label][movement_type] for label in labels]
+        return facets
+
+    if not scope.is_restricted:
+        return load()  # table journalière : lecture directe, déjà agrégée
+    return _cached(f'{CACHE_PREFIX}facets_{_region_key(scope)}_{since.isoformat()}', FACETS_TTL, load)
+
+
+def approximate_count(query, scope, filters):
+    """
+    Nombre de mouvements de la liste filtrée
+
+    Sans filtre, total exact des compteurs journaliers (ou des facettes de la
+    région). Avec filtres, comptage plafonné à COUNT_CAP, mis en cache COUNT_TTL
+    secondes par région et jeu de filtres.
+
+    Returns:
+        tuple: (nombre, plafonné) - plafonné=True signifie « au moins COUNT_CAP »
+    """
+    active = sorted((key, str(value)) for key, value in filters.items() if value not in (None, ''))
+    if not active:
+        return movement_facets(scope)['total'], False
+
+    digest = hashlib.sha1(repr(active).encode('utf-8')).hexdigest()
+
+    def load():
+        ids = query.with_entities(StockMovement.id).order_by(None).limit(COUNT_CAP + 1).subquery()
+        return db.session.execute(select(func.count()).select_from(ids)).scalar() or 0
+
+    count = _cached(f'{CACHE_PREFIX}count_{_region_key(scope)}_{digest}', COUNT_TTL, load)
+    return min(count, COUNT_CAP), count > COUNT_CAP
+
+
+# =========================================================
+# LISTES DES FILTRES
+# =========================================================
+
+def filter_options(scope):
+    """
+    Articles actifs, dépôts et véhicules de la région, utilisateurs
+    (dictionnaires simples, mis en cache par région)
+    """
+    def load():
+        from utils_region_filter import filter_depots_by_region, filter_vehicles_by_region
+
+        depots = filter_depots_by_region(Depot.query.filter_by(is_active=True))
+        vehicles = filter_vehicles_by_region(Vehicle.query.filter_by(status='active'))
+        return {
+            'stock_items': [{'id': row.id, 'name': row.name, 'sku': row.sku} for row in
+                            db.session.query(StockItem.id, StockItem.name, StockItem.sku)
+                            .filter(StockItem.is_active.is_(True)).order_by(StockItem.name)],
+            'depots': [{'id': row.id, 'name': row.name} for row in
+                       depots.with_entities(Depot.id, Depot.name).order_by(Depot.name)],
+            'vehicles': [{'id': row.id, 'plate_number': row.plate_number} for row in
+                         vehicles.with_entities(Vehicle.id, Vehicle.plate_number).order_by(Vehicle.plate_number)],
+            'users': [{'id': row.id, 'username': row.username} for row in
+                      db.session.query(User.id, User.username).order_by(User.username)],
+        }
+
+    return _cached(f'{CACHE_PREFIX}filters_{_region_key(scope)}', FILTER_OPTIONS_TTL, load,
+                   generation=_store.generation())
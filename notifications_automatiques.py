@@ -10,16 +10,24 @@ from datetime import datetime, UTC, timedelta, date
 from decimal import Decimal
 from io import BytesIO
 import logging
+import threading
 from typing import Optional, List, Dict, Any
 
+import job_queue
+
 logger = logging.getLogger(__name__)
 
+
+class NotificationDeliveryError(Exception):
+    """Un ou plusieurs envois ont échoué côté API (la tâche sera retentée)"""
+
 class NotificationsAutomatiques:
     """Gestionnaire de notifications automatiques via Message Pro"""
     
     def __init__(self):
         self.messagepro_api = None
         self.pdf_generator = None
+        self._local = threading.local()
         self._init_apis()
     
     def _init_apis(self):
@@ -70,6 +78,10 @@ class NotificationsAutomatiques:
     
     def _send_whatsapp_notification(self, recipient: str, message: str, pdf_file: Optional[BytesIO] = None, pdf_name: Optional[str] = None) -> bool:
         """Envoie une notification WhatsApp avec optionnellement un PDF"""
+        if recipient in (getattr(self._local, 'delivered', None) or ()):
+            logger.info(f"Notification déjà envoyée à {recipient} lors d'une tentative précédente")
+            return True
+        
         if not self.messagepro_api:
             logger.warning("MessageProAPI non disponible")
             return False
@@ -77,6 +89,7 @@ class NotificationsAutomatiques:
         account_id = self._get_whatsapp_account()
         if not account_id:
             logger.warning("Aucun compte WhatsApp disponible")
+            self._record_failure(recipient, "aucun compte WhatsApp disponible")
             return False
         
         try:
@@ -119,15 +132,18 @@ class NotificationsAutomatiques:
             
             if result.get('status') == 200:
                 logger.info(f"✅ Notification envoyée avec succès à {recipient}")
+                self._record_delivery(recipient)
                 return True
             else:
                 error_msg = result.get('message') or result.get('error') or 'Erreur inconnue'
                 logger.error(f"❌ Erreur lors de l'envoi à {recipient}: {error_msg} (status: {result.get('status')})")
+                self._record_failure(recipient, f"{error_msg} (status: {result.get('status')})")
                 return False
         except Exception as e:
             logger.error(f"❌ Exception lors de l'envoi de notification: {e}")
             import traceback
             traceback.print_exc()
+            self._record_failure(recipient, str(e))
             return False
     
     def _send_sms_notification(self, recipient: str, message: str) -> bool:
@@ -149,11 +165,49 @@ class NotificationsAutomatiques:
                 return True
             else:
                 logger.error(f"Erreur lors de l'envoi SMS à {recipient}: {result.get('message')}")
+                self._record_failure(recipient, result.get('message') or 'Erreur inconnue')
                 return False
         except Exception as e:
             logger.error(f"Erreur lors de l'envoi SMS: {e}")
+            self._record_failure(recipient, str(e))
             return False
     
+    def _record_failure(self, recipient: str, reason: str):
+        """Note un envoi échoué côté API (lu par deliver() pour retenter la tâche)"""
+        failures = getattr(self._local, 'failures', None)
+        if failures is not None:
+            failures.append(f"{recipient}: {reason}")
+    
+    def _record_delivery(self, recipient: str):
+        """Note un envoi réussi dans la tâche en cours : il ne sera pas refait si elle est retentée"""
+        delivered = getattr(self._local, 'delivered', None)
+        if delivered is not None and recipient not in delivered:
+            delivered.append(recipient)
+            job_queue.update_payload(delivered=delivered)
+    
+    def deliver(self, method_name: str, delivered: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        """
+        Exécute une notification depuis la file de tâches
+        
+        Lève NotificationDeliveryError si un envoi a échoué côté API (la tâche
+        est alors retentée) ; une notification sans destinataire n'est pas une
+        erreur et ne sera pas retentée.
+        
+        Les destinataires servis sont notés dans le payload de la tâche
+        (delivered) : une nouvelle tentative ne renvoie le message qu'aux
+        destinataires en échec.
+        """
+        self._local.failures = []
+        self._local.delivered = list(delivered or [])
+        try:
+            sent = getattr(self, method_name)(**kwargs)
+        finally:
+            failures, self._local.failures = self._local.failures, None
+            self._local.delivered = None
+        if failures:
+            raise NotificationDeliveryError('; '.join(failures))
+        return {'sent': bool(sent)}
+    
     def _get_user_phone(self, user) -> Optional[str]:
         """Récupère le numéro de téléphone d'un utilisateur"""
         if not user:
@@ -606,3 +660,46 @@ Veuillez trouver ci-joint le rapport de situation de stock.
 # Instance globale
 notifications_automatiques = NotificationsAutomatiques()
 
+
+# =========================================================
+# TÂCHES DE LA FILE (exécutées par job_queue, hors requête HTTP)
+# =========================================================
+
+@job_queue.task('notifications.commande_creee', queue='notifications')
+def envoyer_notification_creation_commande(order_id):
+    from models import db, CommercialOrder
+    order = db.session.get(CommercialOrder, order_id)
+    if order is None:
+        return {'sent': False, 'skipped': 'commande introuvable'}
+    return notifications_automatiques.deliver('notifier_creation_commande', order=order)
+
+
+@job_queue.task('notifications.commande_validee', queue='notifications')
+def envoyer_notification_validation_commande(order_id):
+    from models import db, CommercialOrder
+    order = db.session.get(CommercialOrder, order_id)
+    if order is None:
+        return {'sent': False, 'skipped': 'commande introuvable'}
+    return notifications_automatiques.deliver('notifier_validation_commande', order=order)
+
+
+@job_queue.task('notifications.rappel_vehicule', queue='notifications')
+def envoyer_rappel_vehicule(vehicle_id, days_until_expiry=15, delivered=None):
+    from models import db, Vehicle
+    vehicle = db.session.get(Vehicle, vehicle_id)
+    if vehicle is None:
+        return {'sent': False, 'skipped': 'véhicule introuvable'}
+    return notifications_automatiques.deliver('notifier_rappel_visage_vehicule', delivered=delivered,
+                                              vehicle=vehicle, days_until_expiry=days_until_expiry)
+
+
+@job_queue.task('notifications.inventaire_stock', queue='reports')
+def envoyer_inventaire_stock(depot_id=None, recipients=None, delivered=None):
+    return notifications_automatiques.deliver('notifier_inventaire_stock', delivered=delivered,
+                                              depot_id=depot_id, recipients=recipients)
+
+
+@job_queue.task('notifications.situation_stock', queue='reports')
+def envoyer_situation_stock(**kwargs):
+    return notifications_automatiques.deliver('notifier_situation_stock_periode', **kwargs)
+
@@ -18,77 +18,26 @@ from auth import has_permission
 from sqlalchemy.orm import joinedload
 from sqlalchemy import or_, and_
 from utils_region_filter import filter_commercial_orders_by_region, get_user_region_id, get_user_accessible_regions
+import reference_sequences
+import stock_mutations
+import job_queue
 
 # Créer le blueprint
 orders_bp = Blueprint('orders', __name__, url_prefix='/orders')
 
 def generate_order_reference():
-    """Génère une référence unique pour une commande"""
-    import time
-    date_str = datetime.now().strftime('%Y%m%d')
-    prefix = 'CMD'
-    
-    # Chercher la dernière commande du jour
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    last_order = CommercialOrder.query.filter(
-        CommercialOrder.reference.like(f'{prefix}-{date_str}-%'),
-        CommercialOrder.created_at >= today_start
-    ).order_by(CommercialOrder.id.desc()).first()
-    
-    if last_order and last_order.reference:
-        try:
-            last_num = int(last_order.reference.split('-')[-1])
-            next_num = last_num + 1
-        except (ValueError, IndexError):
-            next_num = 1
-    else:
-        next_num = 1
-    
-    reference = f"{prefix}-{date_str}-{next_num:04d}"
-    
-    # Vérifier l'unicité
-    while CommercialOrder.query.filter_by(reference=reference).first():
-        time.sleep(1)
-        next_num += 1
-        reference = f"{prefix}-{date_str}-{next_num:04d}"
-    
-    return reference
+    """Génère une référence unique pour une commande (CMD-YYYYMMDD-NNNN)"""
+    return reference_sequences.next_reference('CMD')
 
 def generate_movement_reference(movement_type='transfer'):
     """Génère une référence unique pour un mouvement de stock"""
-    import time
     prefix_map = {
         'transfer': 'TRANS',
         'reception': 'REC',
         'adjustment': 'AJUST',
         'inventory': 'INV'
     }
-    prefix = prefix_map.get(movement_type, 'MV')
-    date_str = datetime.now().strftime('%Y%m%d')
-    
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    last_movement = StockMovement.query.filter(
-        StockMovement.reference.like(f'{prefix}-{date_str}-%'),
-        StockMovement.created_at >= today_start
-    ).order_by(StockMovement.id.desc()).first()
-    
-    if last_movement and last_movement.reference:
-        try:
-            last_num = int(last_movement.reference.split('-')[-1])
-            next_num = last_num + 1
-        except (ValueError, IndexError):
-            next_num = 1
-    else:
-        next_num = 1
-    
-    reference = f"{prefix}-{date_str}-{next_num:04d}"
-    
-    while StockMovement.query.filter_by(reference=reference).first():
-        time.sleep(1)
-        next_num += 1
-        reference = f"{prefix}-{date_str}-{next_num:04d}"
-    
-    return reference
+    return reference_sequences.next_reference(prefix_map.get(movement_type, 'MV'))
 
 @orders_bp.route('/')
 @login_required
@@ -685,6 +634,10 @@ def order_new():
         # Passer en attente de validation
         order.status = 'pending_validation'
         try:
+            db.session.flush()
+            # Notification au superviseur : tâche enregistrée avec la commande, envoyée hors requête
+            job_queue.enqueue('notifications.commande_creee', {'order_id': order.id},
+                              idempotency_key=f'commande_creee:{order.id}')
             db.session.commit()
             # #region agent log
             try:
@@ -704,13 +657,6 @@ def order_new():
             return redirect(url_for('orders.order_new'))
         
         flash(f'Commande "{reference}" créée avec succès et soumise à validation', 'success')
-        
-        # Envoyer notification au superviseur
-        try:
-            from notifications_automatiques import notifications_automatiques
-            notifications_automatiques.notifier_creation_commande(order)
-        except Exception as e:
-            print(f"⚠️ Erreur lors de l'envoi de notification de création: {e}")
         return redirect(url_for('orders.order_detail', id=order.id))
     
     # GET : Afficher le formulaire
@@ -865,6 +811,10 @@ def order_validate(id):
     order.validated_at = datetime.now(UTC)
     db.session.flush()
     
+    # Notification au commercial : validée avec la commande, envoyée hors requête
+    job_queue.enqueue('notifications.commande_validee', {'order_id': order.id},
+                      idempotency_key=f'commande_validee:{order.id}')
+    
     # Générer automatiquement le récapitulatif de chargement
     try:
         from models import StockLoadingSummary, StockLoadingSummaryItem, Depot
@@ -926,13 +876,6 @@ def order_validate(id):
         db.session.commit()
         
         flash(f'Commande "{order.reference}" validée avec succès. Récapitulatif de chargement généré.', 'success')
-        
-        # Envoyer notification au commercial
-        try:
-            from notifications_automatiques import notifications_automatiques
-            notifications_automatiques.notifier_validation_commande(order)
-        except Exception as e:
-            print(f"⚠️ Erreur lors de l'envoi de notification de validation: {e}")
     except Exception as e:
         print(f"⚠️ Erreur lors de la génération du récapitulatif de chargement: {e}")
         import traceback
@@ -1239,6 +1182,7 @@ def order_generate_outgoing(id):
     
     # Créer une sortie pour chaque client de la commande
     created_outgoings = []
+    movement_rows = []
     
     for order_client in order.clients:
         # Créer la sortie pour ce client
@@ -1259,19 +1203,6 @@ def order_generate_outgoing(id):
         
         # Ajouter les articles
         for order_item in order_client.items:
-            # Vérifier le stock disponible
-            if depot_id:
-                stock = DepotStock.query.filter_by(depot_id=depot_id, stock_item_id=order_item.stock_item_id).first()
-            elif vehicle_id:
-                stock = VehicleStock.query.filter_by(vehicle_id=vehicle_id, stock_item_id=order_item.stock_item_id).first()
-            else:
-                stock = None
-            
-            if not stock or stock.quantity < order_item.quantity:
-                flash(f'Stock insuffisant pour {order_item.stock_item.name} (client: {order_client.client_name})', 'error')
-                db.session.rollback()
-                return redirect(url_for('orders.order_detail', id=id))
-            
             # Créer le détail de sortie
             detail = StockOutgoingDetail(
                 outgoing_id=outgoing.id,
@@ -1281,29 +1212,36 @@ def order_generate_outgoing(id):
             )
             db.session.add(detail)
             
-            # Décrémenter le stock
-            stock.quantity -= order_item.quantity
-            
-            # Créer le mouvement de stock
-            movement_ref = generate_movement_reference('transfer')
-            movement = StockMovement(
-                reference=movement_ref,
+            # Mouvement de stock (le dépôt est prioritaire sur le véhicule, comme pour le contrôle de stock)
+            movement_rows.append(dict(
                 movement_type='transfer',
                 movement_date=outgoing_date,
                 stock_item_id=order_item.stock_item_id,
                 quantity=-order_item.quantity,  # Négatif pour sortie
                 user_id=current_user.id,
                 from_depot_id=depot_id,
-                from_vehicle_id=vehicle_id,
-                to_depot_id=None,
-                to_vehicle_id=None,
+                from_vehicle_id=None if depot_id else vehicle_id,
                 reason=f'Sortie client: {order_client.client_name} (Commande: {order.reference})'
-            )
-            db.session.add(movement)
+            ))
         
         outgoing.status = 'completed'
         created_outgoings.append(outgoing)
     
+    # Décrémenter le stock source en une passe : toutes les sorties de la commande ou aucune
+    references = reference_sequences.reserve_references('TRANS', len(movement_rows))
+    for row, movement_ref in zip(movement_rows, references):
+        row['reference'] = movement_ref
+    try:
+        stock_mutations.record_movements(movement_rows)
+    except stock_mutations.InsufficientStockError as e:
+        item_ids = {shortage['stock_item_id'] for shortage in e.shortages}
+        names = dict(db.session.query(StockItem.id, StockItem.name).filter(StockItem.id.in_(item_ids)).all())
+        db.session.rollback()
+        for shortage in e.shortages:
+            flash(f"Stock insuffisant pour {names.get(shortage['stock_item_id'])} "
+                  f"(disponible: {shortage['available']}, requis: {shortage['requested']})", 'error')
+        return redirect(url_for('orders.order_detail', id=id))
+    
     # Marquer la commande comme complétée
     order.status = 'completed'
     db.session.commit()
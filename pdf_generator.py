@@ -12,6 +12,8 @@ from datetime import datetime, UTC
 from decimal import Decimal
 from io import BytesIO
 
+import landed_cost
+
 
 class PDFGenerator:
     """Générateur de rapports PDF"""
@@ -163,89 +165,18 @@ class PDFGenerator:
     
     def generate_simulation_pdf(self, simulation, simulation_items, currency='GNF'):
         """Génère un PDF pour une simulation avec orientation automatique et conversion de devise"""
-        from decimal import Decimal
-        
         # Déterminer le taux de change pour la conversion
-        exchange_rate = None
-        if currency == 'USD':
-            exchange_rate = float(simulation.rate_usd) if simulation.rate_usd else None
-        elif currency == 'EUR':
-            exchange_rate = float(simulation.rate_eur) if simulation.rate_eur else None
-        elif currency == 'XOF':
-            exchange_rate = float(simulation.rate_xof) if simulation.rate_xof else None
-        
-        # Calculer les données détaillées (comme dans preview)
-        total_purchase_value = Decimal('0')
-        total_weight = Decimal('0')
-        total_selling_value = Decimal('0')
-        items_with_cost = []
-        
-        for item in simulation_items:
-            rate = simulation.rate_usd
-            if hasattr(item, 'purchase_currency'):
-                if item.purchase_currency == 'EUR':
-                    rate = simulation.rate_eur
-                elif item.purchase_currency == 'XOF':
-                    rate = simulation.rate_xof if simulation.rate_xof else simulation.rate_usd
-            
-            purchase_price_gnf = Decimal(str(item.purchase_price)) * Decimal(str(rate))
-            item_value = purchase_price_gnf * Decimal(str(item.quantity))
-            item_weight = Decimal(str(item.quantity)) * Decimal(str(item.unit_weight_kg or 0))
-            
-            total_purchase_value += item_value
-            total_weight += item_weight
-            total_selling_value += Decimal(str(item.selling_price_gnf)) * Decimal(str(item.quantity))
-        
-        # Calculer les coûts logistiques
-        total_fixed_costs = (
-            Decimal(str(simulation.customs_gnf or 0)) +
-            Decimal(str(simulation.handling_gnf or 0)) +
-            Decimal(str(simulation.others_gnf or 0)) +
-            Decimal(str(simulation.transport_fixed_gnf or 0))
-        )
-        total_variable_costs = total_weight * Decimal(str(simulation.transport_per_kg_gnf or 0))
-        total_logistics_costs = total_fixed_costs + total_variable_costs
-        
-        # Calculer le prix de revient pour chaque article
-        for item in simulation_items:
-            rate = simulation.rate_usd
-            if hasattr(item, 'purchase_currency'):
-                if item.purchase_currency == 'EUR':
-                    rate = simulation.rate_eur
-                elif item.purchase_currency == 'XOF':
-                    rate = simulation.rate_xof if simulation.rate_xof else simulation.rate_usd
-            
-            purchase_price_gnf = Decimal(str(item.purchase_price)) * Decimal(str(rate))
-            item_value = purchase_price_gnf * Decimal(str(item.quantity))
-            item_weight = Decimal(str(item.quantity)) * Decimal(str(item.unit_weight_kg or 0))
-            
-            logistics_cost = Decimal('0')
-            if simulation.basis == 'value' and total_purchase_value > 0:
-                logistics_cost = (item_value / total_purchase_value) * total_logistics_costs
-            elif simulation.basis == 'weight' and total_weight > 0:
-                logistics_cost = (item_weight / total_weight) * total_logistics_costs
-            
-            logistics_per_unit = logistics_cost / Decimal(str(item.quantity)) if item.quantity > 0 else Decimal('0')
-            cost_price_per_unit = purchase_price_gnf + logistics_per_unit
-            
-            selling_price = Decimal(str(item.selling_price_gnf))
-            margin = selling_price - cost_price_per_unit
-            margin_pct = (margin / cost_price_per_unit * 100) if cost_price_per_unit > 0 else Decimal('0')
-            
-            items_with_cost.append({
-                'item': item,
-                'purchase_price_gnf': purchase_price_gnf,
-                'logistics_per_unit': logistics_per_unit,
-                'cost_price_per_unit': cost_price_per_unit,
-                'total_cost': cost_price_per_unit * Decimal(str(item.quantity)),
-                'selling_price': selling_price,
-                'margin': margin,
-                'margin_pct': margin_pct
-            })
-        
-        total_cost_price = sum(item['total_cost'] for item in items_with_cost)
-        total_margin = sum(item['margin'] * item['item'].quantity for item in items_with_cost)
-        total_margin_pct = (total_margin / total_cost_price * 100) if total_cost_price > 0 else Decimal('0')
+        exchange_rate = landed_cost.conversion_rate(simulation, currency)
+        
+        # Prix de revient par article et totaux (moteur commun landed_cost)
+        costs = landed_cost.landed_costs(simulation, simulation_items)
+        items_with_cost = costs.lines
+        total_purchase_value = costs.total_purchase_value
+        total_selling_value = costs.total_selling_value
+        total_logistics_costs = costs.total_logistics
+        total_cost_price = costs.total_cost
+        total_margin = costs.total_margin
+        total_margin_pct = costs.margin_pct
         
         # Déterminer l'orientation et les largeurs de colonnes
         # Tableau avec 8 colonnes : Article, Qté, Prix Achat, Coûts Log., Prix Revient, Prix Vente, Marge, Marge %
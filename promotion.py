@@ -9,10 +9,13 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta, UTC
 from decimal import Decimal
-from sqlalchemy import func, or_, and_, text, case
+from sqlalchemy import func, or_, and_, text, case, insert, select, update
 from sqlalchemy.orm import joinedload, load_only
 from functools import lru_cache
 import time
+import schema_registry
+import reference_sequences
+import export_engine
 from models import (
     db, PromotionGamme, PromotionTeam, PromotionMember, PromotionSale, 
     PromotionReturn, PromotionMemberLocation, PromotionMemberStock, PromotionTeamStock, 
@@ -97,75 +100,9 @@ def get_low_stock_alerts(threshold=10):
     
     return alerts
 
-# Cache pour les vérifications de colonnes (durée: 1 heure)
-# Note: Utilise maintenant utils.db_adapter qui gère le cache automatiquement
-_column_cache = {}
-_column_cache_time = {}
-
-# Import des fonctions d'adaptation de base de données
-try:
-    from db_utils.db_adapter import check_column_exists, is_postgresql
-except ImportError:
-    # Fallback si le module n'est pas disponible
-    def _is_postgresql_fallback(db_session=None):
-        """Fallback: détecte si on utilise PostgreSQL"""
-        try:
-            uri = str(db.engine.url)
-            return uri.startswith('postgresql://') or uri.startswith('postgresql+psycopg2://')
-        except:
-            return False
-    
-    def check_column_exists(table_name, column_name, db_session=None):
-        """Fallback: vérifie si une colonne existe (compatible MySQL et PostgreSQL)"""
-        try:
-            if _is_postgresql_fallback(db_session):
-                check_sql = text("""
-                    SELECT COUNT(*) 
-                    FROM information_schema.columns 
-                    WHERE table_schema = 'public' 
-                    AND table_name = :table_name 
-                    AND column_name = :column_name
-                """)
-            else:
-                check_sql = text("""
-                    SELECT COUNT(*) 
-                    FROM INFORMATION_SCHEMA.COLUMNS 
-                    WHERE TABLE_SCHEMA = DATABASE() 
-                    AND TABLE_NAME = :table_name 
-                    AND COLUMN_NAME = :column_name
-                """)
-            result = db.session.execute(check_sql, {'table_name': table_name, 'column_name': column_name}).scalar() > 0
-            return result
-        except Exception as e:
-            print(f"Erreur vérification colonne {column_name} dans {table_name}: {e}")
-            return False
-    
-    def is_postgresql(db_session=None):
-        """Fallback: détecte si on utilise PostgreSQL"""
-        return _is_postgresql_fallback(db_session)
-
 def has_transaction_type_column_cached():
-    """Vérifie si la colonne transaction_type existe (avec cache)"""
-    cache_key = 'has_transaction_type'
-    current_time = time.time()
-    
-    # Vérifier le cache (valide pendant 1 heure)
-    if cache_key in _column_cache:
-        if current_time - _column_cache_time.get(cache_key, 0) < 3600:
-            return _column_cache[cache_key]
-    
-    # Requête à la base de données (utilise la fonction d'adaptation)
-    try:
-        result = check_column_exists('promotion_sales', 'transaction_type', db.session)
-        
-        # Mettre en cache
-        _column_cache[cache_key] = result
-        _column_cache_time[cache_key] = current_time
-        
-        return result
-    except Exception as e:
-        print(f"Erreur vérification colonne transaction_type: {e}")
-        return False
+    """Vérifie si la colonne transaction_type existe (registre du schéma, sans requête)"""
+    return schema_registry.has_column('promotion_sales', 'transaction_type')
 
 def load_teams_batch(team_ids):
     """Charge les équipes en batch pour éviter N+1 queries"""
@@ -190,7 +127,8 @@ def load_gammes_batch(gamme_ids):
     if not gamme_ids:
         return {}
     gammes = PromotionGamme.query.options(
-        load_only(PromotionGamme.id, PromotionGamme.name, PromotionGamme.selling_price_gnf)
+        load_only(PromotionGamme.id, PromotionGamme.name, PromotionGamme.selling_price_gnf,
+                  PromotionGamme.commission_per_unit_gnf)
     ).filter(PromotionGamme.id.in_(gamme_ids)).all()
     return {gamme.id: gamme for gamme in gammes}
 
@@ -649,143 +587,178 @@ def generate_supply_reference():
     Génère une référence unique pour un approvisionnement
     Format: APP-YYYYMMDD-NNNN
     """
-    try:
-        prefix = 'APP'
-        date_str = date.today().strftime('%Y%m%d')
-        today_start = datetime.combine(date.today(), datetime.min.time()).replace(tzinfo=UTC)
-        
-        # Chercher la dernière référence du jour
-        next_num = 1
-        try:
-            sql = """SELECT notes FROM promotion_stock_movements 
-                     WHERE notes LIKE :pattern 
-                     AND movement_date >= :today_start
-                     AND movement_type = 'reception'
-                     ORDER BY notes DESC LIMIT 1"""
-            result = db.session.execute(text(sql), {
-                'pattern': f'{prefix}-{date_str}-%',
-                'today_start': today_start
-            })
-            row = result.fetchone()
-            if row and row[0]:
-                try:
-                    last_num = int(row[0].split('-')[-1])
-                    next_num = last_num + 1
-                except (ValueError, IndexError):
-                    next_num = 1
-        except Exception:
-            # Compter les mouvements de réception du jour
-            try:
-                count_sql = """SELECT COUNT(*) FROM promotion_stock_movements 
-                              WHERE movement_date >= :today_start
-                              AND movement_type = 'reception'"""
-                count_result = db.session.execute(text(count_sql), {'today_start': today_start})
-                count = count_result.scalar() or 0
-                next_num = count + 1
-            except Exception:
-                import time
-                next_num = int(time.time()) % 10000
-        
-        reference = f"{prefix}-{date_str}-{next_num:04d}"
-        return reference
-    except Exception as e:
-        import time
-        prefix = 'APP'
-        date_str = date.today().strftime('%Y%m%d')
-        timestamp_part = int(time.time() * 1000) % 100000
-        return f"{prefix}-{date_str}-{timestamp_part:05d}"
+    return reference_sequences.next_reference('APP')
 
 def generate_sale_reference(transaction_type='enlevement'):
     """
     Génère une référence unique pour une vente/retour
     Format: ENL-YYYYMMDD-NNNN pour enlèvements, RET-YYYYMMDD-NNNN pour retours
     """
-    try:
-        prefix = 'ENL' if transaction_type == 'enlevement' else 'RET'
-        date_str = date.today().strftime('%Y%m%d')
-        today_start = datetime.combine(date.today(), datetime.min.time()).replace(tzinfo=UTC)
-        
-        # Vérifier si la colonne reference existe
-        check_sql = """SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
-                      WHERE TABLE_SCHEMA = DATABASE() 
-                      AND TABLE_NAME = 'promotion_sales' 
-                      AND COLUMN_NAME = 'reference'"""
-        has_reference = db.session.execute(text(check_sql)).scalar() > 0
-        
-        if not has_reference:
-            # Si la colonne n'existe pas, utiliser un timestamp
-            import time
-            timestamp_part = int(time.time() * 1000) % 100000
-            return f"{prefix}-{date_str}-{timestamp_part:05d}"
-        
-        # Stratégie 1: Chercher la dernière référence du jour avec le même préfixe
-        next_num = 1
-        try:
-            sql = """SELECT reference FROM promotion_sales 
-                     WHERE reference LIKE :pattern 
-                     AND created_at >= :today_start
-                     ORDER BY reference DESC LIMIT 1"""
-            result = db.session.execute(text(sql), {
-                'pattern': f'{prefix}-{date_str}-%',
-                'today_start': today_start
+    return reference_sequences.next_reference('ENL' if transaction_type == 'enlevement' else 'RET')
+
+def allocate_sale_references(transaction_type, count):
+    """
+    Réserve un bloc de `count` références consécutives de vente/retour du jour
+    (ENL-YYYYMMDD-NNNN / RET-YYYYMMDD-NNNN) en une instruction
+    """
+    return reference_sequences.reserve_references('ENL' if transaction_type == 'enlevement' else 'RET', count)
+
+def save_quick_sales_batch(entries, recorded_by_id):
+    """
+    Enregistre un lot de saisie rapide (enlèvements et retours) en une seule transaction
+
+    Membres, gammes et stocks du lot sont chargés en quelques requêtes, les
+    lignes de stock concernées sont verrouillées (FOR UPDATE pour les membres,
+    FOR SHARE pour les équipes), la disponibilité est vérifiée en mémoire ligne
+    par ligne, puis ventes, stocks et mouvements sont écrits par insertions et
+    mises à jour groupées avant un unique commit. Le nombre de requêtes ne
+    dépend pas de la taille du lot.
+
+    Règles (inchangées) :
+    - enlèvement : l'équipe du membre doit disposer de la quantité ; le stock du membre augmente
+    - retour : le membre doit disposer de la quantité (en tenant compte des lignes précédentes du lot)
+
+    Args:
+        entries: Liste de dicts {line, member_id, gamme_id, quantity, sale_date, transaction_type}
+        recorded_by_id: Utilisateur qui enregistre
+
+    Returns:
+        tuple: (nombre de ventes enregistrées, liste des erreurs par ligne)
+    """
+    errors = []
+    entries = [entry for entry in entries if entry['quantity'] > 0]
+    if not entries:
+        return 0, errors
+
+    track_movements = schema_registry.has_table('promotion_stock_movements')
+    members = load_members_batch({entry['member_id'] for entry in entries})
+    gammes = load_gammes_batch({entry['gamme_id'] for entry in entries})
+    member_ids = sorted(members)
+    gamme_ids = sorted(gammes)
+    team_ids = sorted({member.team_id for member in members.values() if member.team_id})
+
+    # Verrous pris dans un ordre stable pour éviter les interblocages entre lots concurrents
+    member_stock_rows = db.session.execute(
+        select(PromotionMemberStock.id, PromotionMemberStock.member_id,
+               PromotionMemberStock.gamme_id, PromotionMemberStock.quantity)
+        .where(PromotionMemberStock.member_id.in_(member_ids), PromotionMemberStock.gamme_id.in_(gamme_ids))
+        .order_by(PromotionMemberStock.member_id, PromotionMemberStock.gamme_id)
+        .with_for_update()
+    ).all() if member_ids and gamme_ids else []
+    team_stock = {
+        (row.team_id, row.gamme_id): row.quantity
+        for row in db.session.execute(
+            select(PromotionTeamStock.team_id, PromotionTeamStock.gamme_id, PromotionTeamStock.quantity)
+            .where(PromotionTeamStock.team_id.in_(team_ids), PromotionTeamStock.gamme_id.in_(gamme_ids))
+            .order_by(PromotionTeamStock.team_id, PromotionTeamStock.gamme_id)
+            .with_for_update(read=True)
+        )
+    } if team_ids and gamme_ids else {}
+
+    stock_ids = {(row.member_id, row.gamme_id): row.id for row in member_stock_rows}
+    balances = {(row.member_id, row.gamme_id): row.quantity for row in member_stock_rows}
+
+    # Validation en mémoire, ligne par ligne
+    accepted = []
+    for entry in entries:
+        line = entry['line']
+        quantity = entry['quantity']
+        transaction_type = entry['transaction_type']
+        member = members.get(entry['member_id'])
+        if not member:
+            errors.append(f"Entrée {line}: Membre introuvable")
+            continue
+        gamme = gammes.get(entry['gamme_id'])
+        if not gamme:
+            errors.append(f"Entrée {line}: Gamme introuvable")
+            continue
+        key = (member.id, gamme.id)
+        current = balances.get(key, 0)
+        if transaction_type == 'enlevement':
+            if member.team_id:
+                available = team_stock.get((member.team_id, gamme.id), 0)
+                if available < quantity:
+                    errors.append(f"⚠️ Entrée {line}: Stock insuffisant dans l'équipe pour {member.full_name}! Stock disponible: {available}, demandé: {quantity} de {gamme.name}. Veuillez d'abord approvisionner l'équipe.")
+                    continue
+            balances[key] = current + quantity
+        elif transaction_type == 'retour':
+            if current < quantity:
+                errors.append(f"⚠️ Entrée {line}: Stock insuffisant pour le retour de {member.full_name}! Stock disponible: {current}, retour demandé: {quantity} de {gamme.name}")
+                continue
+            balances[key] = current - quantity
+        else:
+            errors.append(f"Entrée {line}: Type de transaction inconnu ({transaction_type})")
+            continue
+        accepted.append((entry, member, gamme, balances[key]))
+
+    if not accepted:
+        db.session.rollback()  # libère les verrous
+        return 0, errors
+
+    # Références réservées par bloc, une requête par type de transaction
+    references = {}
+    for transaction_type in ('enlevement', 'retour'):
+        count = sum(1 for entry, _, _, _ in accepted if entry['transaction_type'] == transaction_type)
+        if count:
+            references[transaction_type] = iter(allocate_sale_references(transaction_type, count))
+
+    now = datetime.now(UTC)
+    sale_rows = []
+    for entry, member, gamme, _ in accepted:
+        quantity = entry['quantity']
+        sale_rows.append({
+            'reference': next(references[entry['transaction_type']]),
+            'member_id': member.id,
+            'gamme_id': gamme.id,
+            'transaction_type': entry['transaction_type'],
+            'quantity': quantity,
+            'selling_price_gnf': gamme.selling_price_gnf,
+            'total_amount_gnf': gamme.selling_price_gnf * quantity,
+            'commission_per_unit_gnf': gamme.commission_per_unit_gnf,
+            'commission_gnf': gamme.commission_per_unit_gnf * quantity,
+            'sale_date': entry['sale_date'],
+            'recorded_by_id': recorded_by_id,
+            'created_at': now
+        })
+    db.session.execute(insert(PromotionSale), sale_rows)
+    sale_ids = dict(db.session.execute(
+        select(PromotionSale.reference, PromotionSale.id)
+        .where(PromotionSale.reference.in_([row['reference'] for row in sale_rows]))
+    ).all())
+
+    # Stocks des membres : mise à jour groupée des lignes existantes, insertion des nouvelles
+    touched = {(member.id, gamme.id) for _, member, gamme, _ in accepted}
+    stock_updates = [{'id': stock_ids[key], 'quantity': balances[key], 'last_updated': now}
+                     for key in touched if key in stock_ids]
+    stock_inserts = [{'member_id': key[0], 'gamme_id': key[1], 'quantity': balances[key],
+                      'last_updated': now, 'created_at': now}
+                     for key in touched if key not in stock_ids]
+    if stock_updates:
+        db.session.execute(update(PromotionMemberStock), stock_updates)
+    if stock_inserts:
+        db.session.execute(insert(PromotionMemberStock), stock_inserts)
+
+    # Historique des mouvements (quantité = stock du membre après la ligne)
+    if track_movements:
+        movement_rows = []
+        for (entry, member, gamme, balance_after), sale_row in zip(accepted, sale_rows):
+            is_enlevement = entry['transaction_type'] == 'enlevement'
+            movement_rows.append({
+                'movement_type': entry['transaction_type'],
+                'movement_date': datetime.combine(entry['sale_date'], datetime.min.time()),
+                'gamme_id': gamme.id,
+                'quantity': abs(balance_after),
+                'quantity_change': entry['quantity'] if is_enlevement else -entry['quantity'],
+                'to_member_id': member.id if is_enlevement else None,
+                'from_member_id': None if is_enlevement else member.id,
+                'sale_id': sale_ids.get(sale_row['reference']) if is_enlevement else None,
+                'performed_by_id': recorded_by_id,
+                'created_at': now
             })
-            row = result.fetchone()
-            if row and row[0]:
-                try:
-                    last_num = int(row[0].split('-')[-1])
-                    next_num = last_num + 1
-                except (ValueError, IndexError):
-                    next_num = 1
-        except Exception:
-            # Stratégie 2: Compter toutes les ventes du jour (même sans référence)
-            try:
-                count_sql = """SELECT COUNT(*) FROM promotion_sales 
-                              WHERE created_at >= :today_start"""
-                count_result = db.session.execute(text(count_sql), {'today_start': today_start})
-                count = count_result.scalar() or 0
-                next_num = count + 1
-            except Exception:
-                # Stratégie 3: Utiliser le dernier ID
-                try:
-                    last_id_sql = "SELECT MAX(id) FROM promotion_sales"
-                    last_id_result = db.session.execute(text(last_id_sql))
-                    last_id = last_id_result.scalar() or 0
-                    next_num = last_id + 1
-                except Exception:
-                    # Dernier recours: timestamp
-                    import time
-                    next_num = int(time.time()) % 10000
-        
-        # Générer la référence
-        reference = f"{prefix}-{date_str}-{next_num:04d}"
-        
-        # Vérifier l'unicité (si la colonne existe)
-        max_attempts = 10
-        attempt = 0
-        while attempt < max_attempts:
-            try:
-                check_sql = "SELECT COUNT(*) FROM promotion_sales WHERE reference = :ref"
-                check_result = db.session.execute(text(check_sql), {'ref': reference})
-                exists = check_result.scalar() or 0
-                if exists == 0:
-                    break  # Référence unique trouvée
-                else:
-                    # Incrémenter et réessayer
-                    next_num += 1
-                    reference = f"{prefix}-{date_str}-{next_num:04d}"
-                    attempt += 1
-            except Exception:
-                # Si la colonne n'existe pas, on ne peut pas vérifier, mais on retourne la référence générée
-                break
-        
-        return reference
-    except Exception as e:
-        # Fallback absolu avec timestamp pour garantir l'unicité
-        import time
-        prefix = 'ENL' if transaction_type == 'enlevement' else 'RET'
-        date_str = date.today().strftime('%Y%m%d')
-        timestamp_part = int(time.time() * 1000) % 100000  # Utiliser millisecondes pour plus d'unicité
-        return f"{prefix}-{date_str}-{timestamp_part:05d}"
+        db.session.execute(PromotionStockMovement.__table__.insert(), movement_rows)
+
+    db.session.commit()
+    return len(accepted), errors
 
 # =========================================================
 # WORKFLOW - PROCESSUS DE PROMOTION
@@ -886,7 +859,7 @@ def workflow():
             
             # Récupérer les ventes du jour (enlèvements - retours)
             try:
-                has_transaction_type = _check_column_exists('promotion_sales', 'transaction_type')
+                has_transaction_type = schema_registry.has_column('promotion_sales', 'transaction_type')
                 
                 if has_transaction_type:
                     enlevements = db.session.query(func.sum(PromotionSale.quantity)).filter(
@@ -931,7 +904,7 @@ def workflow():
     
     # Statistiques du jour
     try:
-        has_transaction_type = _check_column_exists('promotion_sales', 'transaction_type')
+        has_transaction_type = schema_registry.has_column('promotion_sales', 'transaction_type')
         
         if has_transaction_type:
             enlevements_today = db.session.query(func.sum(PromotionSale.quantity)).filter(
@@ -1098,8 +1071,8 @@ def dashboard():
         is_day_closed = False
         daily_closure = None
     
-    # Vérifier si transaction_type existe (utilise la fonction d'adaptation)
-    has_transaction_type = check_column_exists('promotion_sales', 'transaction_type', db.session)
+    # Vérifier si transaction_type existe (registre du schéma)
+    has_transaction_type = schema_registry.has_column('promotion_sales', 'transaction_type')
     
     # Statistiques de base avec filtrage par région
     from utils_region_filter import filter_teams_by_region
@@ -1574,11 +1547,7 @@ def team_detail(id):
         for member in members_query:
             # Calculer les statistiques pour chaque membre
             try:
-                check_type_sql = """SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS 
-                                   WHERE TABLE_SCHEMA = DATABASE() 
-                                   AND TABLE_NAME = 'promotion_sales' 
-                                   AND COLUMN_NAME = 'transaction_type'"""
-                has_transaction_type = db.session.execute(text(check_type_sql)).scalar() > 0
+                has_transaction_type = schema_registry.has_column('promotion_sales', 'transaction_type')
                 
                 if has_transaction_type:
                     sales_count = db.session.query(func.count(PromotionSale.id)).filter(
@@ -3347,8 +3316,8 @@ def sales_list():
     query = PromotionSale.query
     query = filter_sales_by_region(query)
     
-    # Vérifier si transaction_type existe (utilise la fonction d'adaptation)
-    has_transaction_type = check_column_exists('promotion_sales', 'transaction_type', db.session)
+    # Vérifier si transaction_type existe (registre du schéma)
+    has_transaction_type = schema_registry.has_column('promotion_sales', 'transaction_type')
     
     # Appliquer les filtres
     if member_id:
@@ -3709,165 +3678,110 @@ def sales_export_pdf():
         flash(f'Erreur lors de l\'export PDF: {str(e)}', 'error')
         return redirect(url_for('promotion.sales_list'))
 
+SALE_EXPORT_COLUMNS = ['Date', 'Référence', 'Type', 'Membre', 'Équipe', 'Gamme', 'Quantité', 'Prix Unitaire (GNF)',
+                       'Montant Total (GNF)', 'Commission Unitaire (GNF)', 'Commission Totale (GNF)']
+
+
+@export_engine.exporter('promotion.sales', sheet_name='Ventes', filename='ventes_promotion',
+                        columns=SALE_EXPORT_COLUMNS, max_width=30,
+                        totals=['Quantité', 'Montant Total (GNF)', 'Commission Totale (GNF)'])
+def _export_sales(args):
+    """Requête et lignes de l'export des ventes (mêmes filtres que sales_list)"""
+    search = args.get('search', '').strip()
+    member_id = args.get('member_id', type=int)
+    gamme_id = args.get('gamme_id', type=int)
+    transaction_type = args.get('transaction_type', '')
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    
+    query = PromotionSale.query
+    
+    # Vérifier si transaction_type existe
+    has_transaction_type = has_transaction_type_column_cached()
+    
+    # Appliquer les filtres
+    if member_id:
+        query = query.filter_by(member_id=member_id)
+    if gamme_id:
+        query = query.filter_by(gamme_id=gamme_id)
+    if date_from:
+        try:
+            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
+            query = query.filter(PromotionSale.sale_date >= date_from_obj)
+        except:
+            pass
+    if date_to:
+        try:
+            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
+            query = query.filter(PromotionSale.sale_date <= date_to_obj)
+        except:
+            pass
+    
+    if has_transaction_type and transaction_type:
+        query = query.filter(PromotionSale.transaction_type == transaction_type)
+    
+    # Recherche (membres correspondants en sous-requête)
+    if search:
+        query = query.filter(
+            or_(
+                PromotionSale.member_id.in_(
+                    select(PromotionMember.id).where(PromotionMember.full_name.ilike(f'%{search}%'))
+                ),
+                PromotionSale.reference.ilike(f'%{search}%')
+            )
+        )
+    
+    load_columns = [
+        PromotionSale.id, PromotionSale.member_id, PromotionSale.gamme_id,
+        PromotionSale.quantity, PromotionSale.total_amount_gnf,
+        PromotionSale.commission_gnf, PromotionSale.sale_date,
+        PromotionSale.created_at, PromotionSale.reference
+    ]
+    
+    if has_transaction_type:
+        load_columns.append(PromotionSale.transaction_type)
+    
+    def rows(sales):
+        for batch in export_engine.batches(sales):
+            # Charger les relations en batch (un lot de ventes à la fois)
+            members_map = load_members_batch(list({s.member_id for s in batch}))
+            gammes_map = load_gammes_batch(list({s.gamme_id for s in batch}))
+            teams_map = load_teams_batch(list({m.team_id for m in members_map.values() if m and m.team_id}))
+            
+            for sale in batch:
+                member = members_map.get(sale.member_id)
+                team = teams_map.get(member.team_id) if member and member.team_id else None
+                gamme = gammes_map.get(sale.gamme_id)
+                transaction_type_val = getattr(sale, 'transaction_type', 'enlevement') if has_transaction_type else 'enlevement'
+                
+                yield [
+                    sale.sale_date.strftime('%d/%m/%Y') if sale.sale_date else '',
+                    sale.reference or '',
+                    transaction_type_val.title(),
+                    member.full_name if member else 'N/A',
+                    team.name if team else 'N/A',
+                    gamme.name if gamme else 'N/A',
+                    sale.quantity,
+                    float(sale.total_amount_gnf / sale.quantity) if sale.quantity > 0 else 0,
+                    float(sale.total_amount_gnf),
+                    float(sale.commission_gnf / sale.quantity) if sale.quantity > 0 else 0,
+                    float(sale.commission_gnf),
+                ]
+    
+    return query.options(load_only(*load_columns)).order_by(
+        PromotionSale.created_at.desc(), PromotionSale.id.desc()
+    ), rows
+
 @promotion_bp.route('/sales/export/excel')
 @login_required
 def sales_export_excel():
-    """Export Excel des ventes avec filtres appliqués"""
+    """Export Excel (ou CSV avec format=csv) des ventes avec filtres appliqués"""
     if not has_permission(current_user, 'promotion.read'):
         flash("Vous n'avez pas la permission d'exporter les données.", "error")
         return redirect(url_for('promotion.sales_list'))
     
-    from flask import make_response
-    import pandas as pd
-    from io import BytesIO
-    
-    # Récupérer les mêmes filtres que sales_list
-    search = request.args.get('search', '').strip()
-    team_id = request.args.get('team_id', type=int)
-    member_id = request.args.get('member_id', type=int)
-    gamme_id = request.args.get('gamme_id', type=int)
-    transaction_type = request.args.get('transaction_type', '')
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    
     try:
-        # Construire la requête (même logique que sales_list)
-        query = PromotionSale.query
-        
-        # Vérifier si transaction_type existe
-        has_transaction_type = has_transaction_type_column_cached()
-        
-        # Appliquer les filtres
-        if member_id:
-            query = query.filter_by(member_id=member_id)
-        if gamme_id:
-            query = query.filter_by(gamme_id=gamme_id)
-        if date_from:
-            try:
-                date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
-                query = query.filter(PromotionSale.sale_date >= date_from_obj)
-            except:
-                pass
-        if date_to:
-            try:
-                date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
-                query = query.filter(PromotionSale.sale_date <= date_to_obj)
-            except:
-                pass
-        
-        if has_transaction_type and transaction_type:
-            query = query.filter(PromotionSale.transaction_type == transaction_type)
-        
-        # Recherche
-        if search:
-            try:
-                member_ids_search = [row[0] for row in db.session.query(PromotionMember.id).filter(
-                    PromotionMember.full_name.ilike(f'%{search}%')
-                ).all()]
-                
-                if member_ids_search:
-                    query = query.filter(
-                        or_(
-                            PromotionSale.member_id.in_(member_ids_search),
-                            PromotionSale.reference.ilike(f'%{search}%')
-                        )
-                    )
-                else:
-                    query = query.filter(PromotionSale.reference.ilike(f'%{search}%'))
-            except:
-                query = query.filter(PromotionSale.reference.ilike(f'%{search}%'))
-        
-        # Récupérer toutes les ventes (sans limite pour l'export)
-        load_columns = [
-            PromotionSale.id, PromotionSale.member_id, PromotionSale.gamme_id,
-            PromotionSale.quantity, PromotionSale.total_amount_gnf,
-            PromotionSale.commission_gnf, PromotionSale.sale_date,
-            PromotionSale.created_at, PromotionSale.reference
-        ]
-        
-        if has_transaction_type:
-            load_columns.append(PromotionSale.transaction_type)
-        
-        sales = query.options(load_only(*load_columns)).order_by(
-            PromotionSale.created_at.desc()
-        ).all()
-        
-        # Charger les relations en batch
-        member_ids = list(set([s.member_id for s in sales]))
-        gamme_ids = list(set([s.gamme_id for s in sales]))
-        
-        members_map = load_members_batch(member_ids)
-        gammes_map = load_gammes_batch(gamme_ids)
-        team_ids = list(set([m.team_id for m in members_map.values() if m and m.team_id]))
-        teams_map = load_teams_batch(team_ids)
-        
-        for member in members_map.values():
-            if member and member.team_id:
-                member.team = teams_map.get(member.team_id)
-        
-        # Préparer les données pour Excel
-        data = []
-        for sale in sales:
-            member = members_map.get(sale.member_id)
-            gamme = gammes_map.get(sale.gamme_id)
-            transaction_type_val = getattr(sale, 'transaction_type', 'enlevement') if has_transaction_type else 'enlevement'
-            
-            data.append({
-                'Date': sale.sale_date.strftime('%d/%m/%Y') if sale.sale_date else '',
-                'Référence': sale.reference or '',
-                'Type': transaction_type_val.title(),
-                'Membre': member.full_name if member else 'N/A',
-                'Équipe': member.team.name if member and member.team else 'N/A',
-                'Gamme': gamme.name if gamme else 'N/A',
-                'Quantité': sale.quantity,
-                'Prix Unitaire (GNF)': float(sale.total_amount_gnf / sale.quantity) if sale.quantity > 0 else 0,
-                'Montant Total (GNF)': float(sale.total_amount_gnf),
-                'Commission Unitaire (GNF)': float(sale.commission_gnf / sale.quantity) if sale.quantity > 0 else 0,
-                'Commission Totale (GNF)': float(sale.commission_gnf),
-            })
-        
-        # Créer le DataFrame
-        df = pd.DataFrame(data)
-        
-        # Ajouter une ligne de totaux
-        if len(df) > 0:
-            total_row = pd.DataFrame([{
-                'Date': 'TOTAL',
-                'Référence': '',
-                'Type': '',
-                'Membre': '',
-                'Équipe': '',
-                'Gamme': '',
-                'Quantité': df['Quantité'].sum(),
-                'Prix Unitaire (GNF)': '',
-                'Montant Total (GNF)': df['Montant Total (GNF)'].sum(),
-                'Commission Unitaire (GNF)': '',
-                'Commission Totale (GNF)': df['Commission Totale (GNF)'].sum(),
-            }])
-            df = pd.concat([df, total_row], ignore_index=True)
-        
-        # Créer le fichier Excel
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Ventes', index=False)
-            
-            # Formater les colonnes
-            worksheet = writer.sheets['Ventes']
-            for idx, col in enumerate(df.columns, 1):
-                max_length = max(
-                    df[col].astype(str).map(len).max(),
-                    len(str(col))
-                )
-                worksheet.column_dimensions[chr(64 + idx)].width = min(max_length + 2, 30)
-        
-        output.seek(0)
-        filename = f'ventes_promotion_{datetime.now(UTC).strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
-        
+        return export_engine.export_response('promotion.sales')
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -3894,9 +3808,9 @@ def sale_new():
             sale_date_str = request.form.get('sale_date', '')
             sale_date = datetime.strptime(sale_date_str, '%Y-%m-%d').date() if sale_date_str else date.today()
             
-            # Vérifier si les colonnes existent (utilise les fonctions d'adaptation)
-            has_reference = check_column_exists('promotion_sales', 'reference', db.session)
-            has_transaction_type = check_column_exists('promotion_sales', 'transaction_type', db.session)
+            # Vérifier si les colonnes existent (registre du schéma)
+            has_reference = schema_registry.has_column('promotion_sales', 'reference')
+            has_transaction_type = schema_registry.has_column('promotion_sales', 'transaction_type')
             
             # Récupérer toutes les ventes (plusieurs gammes/pièces)
             sales_data = []
@@ -3965,12 +3879,9 @@ def sale_new():
                 flash("Veuillez ajouter au moins une gamme/pièce avec une quantité valide.", "error")
                 return redirect(url_for('promotion.sale_new'))
             
-            # Générer une référence pour chaque vente
-            reference = generate_sale_reference(transaction_type)
-            
-            # Vérifier si les colonnes existent (utilise les fonctions d'adaptation)
-            has_reference = check_column_exists('promotion_sales', 'reference', db.session)
-            has_transaction_type = check_column_exists('promotion_sales', 'transaction_type', db.session)
+            # Vérifier si les colonnes existent (registre du schéma)
+            has_reference = schema_registry.has_column('promotion_sales', 'reference')
+            has_transaction_type = schema_registry.has_column('promotion_sales', 'transaction_type')
             
             # Traiter toutes les ventes
             saved_count = 0
@@ -4009,8 +3920,7 @@ def sale_new():
                         
                         # Fallback: SQL direct
                         try:
-                            sale_reference = generate_sale_reference(transaction_type)
-                            
+                            # La référence réservée n'a pas été utilisée : on la conserve
                             if has_reference and has_transaction_type:
                                 sql = """INSERT INTO promotion_sales 
                                          (reference, member_id, gamme_id, transaction_type, quantity, 
@@ -4311,8 +4221,8 @@ def quick_sales_save():
         return redirect(url_for('promotion.quick_entry'))
     
     try:
-        saved_count = 0
         errors = []
+        entries = []
         
         # Parcourir les entrées du formulaire
         i = 1
@@ -4322,95 +4232,28 @@ def quick_sales_save():
                 break
             
             try:
-                gamme_id = int(request.form.get(f'gamme_id_{i}', 0))
-                quantity = int(request.form.get(f'quantity_{i}', 0))
                 sale_date_str = request.form.get(f'sale_date_{i}', '')
-                transaction_type = request.form.get(f'transaction_type_{i}', 'enlevement')
-                
-                if quantity <= 0:
-                    i += 1
-                    continue
-                
-                member = get_member_safe(int(member_id))
-                if not member:
-                    errors.append(f"Entrée {i}: Membre introuvable")
-                    i += 1
-                    continue
-                
-                gamme = PromotionGamme.query.get(gamme_id)
-                if not gamme:
-                    errors.append(f"Entrée {i}: Gamme introuvable")
-                    i += 1
-                    continue
-                
-                if sale_date_str:
-                    sale_date = datetime.strptime(sale_date_str, '%Y-%m-%d').date()
-                else:
-                    sale_date = date.today()
-                
-                # Vérifier le stock avant l'opération
-                if transaction_type == 'enlevement':
-                    # Pour un enlèvement, vérifier que l'équipe a assez de stock
-                    if member.team_id:
-                        team_stock = get_team_stock(member.team_id)
-                        current_team_stock = team_stock.get(gamme_id, 0)
-                        if current_team_stock < quantity:
-                            errors.append(f"⚠️ Entrée {i}: Stock insuffisant dans l'équipe pour {member.full_name}! Stock disponible: {current_team_stock}, demandé: {quantity} de {gamme.name}. Veuillez d'abord approvisionner l'équipe.")
-                            i += 1
-                            continue
-                elif transaction_type == 'retour':
-                    # Pour un retour, vérifier que le membre a assez de stock
-                    member_stock = get_member_stock(int(member_id))
-                    current_member_stock = member_stock.get(gamme_id, 0)
-                    if current_member_stock < quantity:
-                        errors.append(f"⚠️ Entrée {i}: Stock insuffisant pour le retour de {member.full_name}! Stock disponible: {current_member_stock}, retour demandé: {quantity} de {gamme.name}")
-                        i += 1
-                        continue
-                
-                selling_price_per_unit = gamme.selling_price_gnf
-                commission_per_unit = gamme.commission_per_unit_gnf
-                total_amount = selling_price_per_unit * quantity
-                total_commission = commission_per_unit * quantity
-                
-                reference = generate_sale_reference(transaction_type)
-                
-                sale = PromotionSale(
-                    reference=reference,
-                    member_id=int(member_id),
-                    gamme_id=gamme_id,
-                    transaction_type=transaction_type,
-                    quantity=quantity,
-                    selling_price_gnf=selling_price_per_unit,
-                    total_amount_gnf=total_amount,
-                    commission_per_unit_gnf=commission_per_unit,
-                    commission_gnf=total_commission,
-                    sale_date=sale_date,
-                    recorded_by_id=current_user.id
-                )
-                
-                db.session.add(sale)
-                db.session.flush()  # Pour obtenir l'ID de la vente
-                
-                # Récupérer l'ID de la vente créée
-                sale_id = sale.id if hasattr(sale, 'id') and sale.id else None
-                
-                if transaction_type == 'enlevement':
-                    update_member_stock(int(member_id), gamme_id, quantity, 'enlevement',
-                                       sale_id=sale_id, movement_date=sale_date)
-                elif transaction_type == 'retour':
-                    update_member_stock(int(member_id), gamme_id, quantity, 'retour',
-                                       sale_id=sale_id, movement_date=sale_date)
-                
-                saved_count += 1
-                
+                entries.append({
+                    'line': i,
+                    'member_id': int(member_id),
+                    'gamme_id': int(request.form.get(f'gamme_id_{i}', 0)),
+                    'quantity': int(request.form.get(f'quantity_{i}', 0)),
+                    'sale_date': datetime.strptime(sale_date_str, '%Y-%m-%d').date() if sale_date_str else date.today(),
+                    'transaction_type': request.form.get(f'transaction_type_{i}', 'enlevement')
+                })
             except Exception as e:
                 errors.append(f"Entrée {i}: {str(e)}")
             
             i += 1
         
+        # Validation et écriture du lot entier en une transaction
+        saved_count, batch_errors = save_quick_sales_batch(entries, current_user.id)
+        errors.extend(batch_errors)
+        
         if saved_count > 0:
-            db.session.commit()
             flash(f"{saved_count} vente(s) enregistrée(s) avec succès!", "success")
+            for error in errors[:5]:
+                flash(error, "warning")
         else:
             flash("Aucune vente n'a pu être enregistrée.", "error")
             if errors:
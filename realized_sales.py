@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ventes réalisées (sorties de stock terminées) calculées en masse
+
+Une seule requête groupée donne, pour un ensemble d'articles et de périodes,
+la quantité totale, la quantité moyenne par ligne, la valeur et le nombre de
+lignes de sortie : le nombre de requêtes ne dépend plus du nombre de lignes de
+prévision ni du nombre de sorties.
+
+- realized_sales(windows) : fenêtres quelconques (article, début, fin)
+- realized_sales_for_forecasts(forecast_ids) : chaque article de prévision sur la période de sa prévision
+- realized_value_by_forecast(forecast_ids) : valeur réalisée totale par prévision
+
+Une sortie compte pour une période si elle est terminée ('completed') et que
+son jour (outgoing_date) est compris entre les dates de début et de fin incluses.
+"""
+
+from decimal import Decimal
+
+from sqlalchemy import Date, case, func, literal, select, union_all
+
+from models import db, Forecast, ForecastItem, StockOutgoing, StockOutgoingDetail
+
+
+def empty_stats():
+    return {'total_quantity': 0.0, 'avg_quantity': 0.0, 'total_value': 0.0, 'count': 0}
+
+
+def _stats(total_quantity, total_value, count):
+    total_quantity = Decimal(str(total_quantity or 0))
+    count = int(count or 0)
+    return {
+        'total_quantity': float(total_quantity),
+        'avg_quantity': float(total_quantity / count) if count > 0 else 0.0,
+        'total_value': float(Decimal(str(total_value or 0))),
+        'count': count
+    }
+
+
+def _aggregates():
+    """Colonnes agrégées communes (la valeur ignore les lignes sans prix, comme auparavant)"""
+    line_value = StockOutgoingDetail.quantity * func.coalesce(StockOutgoingDetail.unit_price_gnf, 0)
+    return (
+        func.sum(StockOutgoingDetail.quantity).label('total_quantity'),
+        func.sum(line_value).label('total_value'),
+        func.count(StockOutgoingDetail.id).label('lines_count')
+    )
+
+
+def realized_sales(windows):
+    """
+    Ventes réalisées pour plusieurs (article, période) en une requête groupée
+
+    Les périodes distinctes forment une table dérivée (UNION ALL de littéraux)
+    jointe aux lignes de sortie ; le résultat est groupé par (période, article).
+
+    Args:
+        windows: Itérable de tuples (stock_item_id, start_date, end_date)
+
+    Returns:
+        dict: {(stock_item_id, start_date, end_date): {'total_quantity', 'avg_quantity',
+               'total_value', 'count'}}
+    """
+    windows = list(dict.fromkeys(windows))
+    results = {window: empty_stats() for window in windows}
+    if not windows:
+        return results
+
+    periods = list(dict.fromkeys((start, end) for _, start, end in windows))
+    period_ids = {period: index for index, period in enumerate(periods)}
+    period_table = union_all(*[
+        select(
+            literal(index).label('period_id'),
+            literal(start, Date).label('start_date'),
+            literal(end, Date).label('end_date')
+        )
+        for (start, end), index in period_ids.items()
+    ]).subquery('periods')
+
+    outgoing_day = func.date(StockOutgoing.outgoing_date)
+    stock_item_ids = sorted({stock_item_id for stock_item_id, _, _ in windows})
+    rows = db.session.execute(
+        select(period_table.c.period_id, StockOutgoingDetail.stock_item_id, *_aggregates())
+        .select_from(StockOutgoingDetail)
+        .join(StockOutgoing, StockOutgoing.id == StockOutgoingDetail.outgoing_id)
+        .join(period_table, (outgoing_day >= period_table.c.start_date) & (outgoing_day <= period_table.c.end_date))
+        .where(StockOutgoing.status == 'completed', StockOutgoingDetail.stock_item_id.in_(stock_item_ids))
+        .group_by(period_table.c.period_id, StockOutgoingDetail.stock_item_id)
+    ).all()
+
+    for row in rows:
+        start, end = periods[row.period_id]
+        window = (row.stock_item_id, start, end)
+        if window in results:
+            results[window] = _stats(row.total_quantity, row.total_value, row.lines_count)
+    return results
+
+
+def _forecast_rows(forecast_ids, group_column):
+    """
+    Articles de prévision ⋈ lignes de sortie ⋈ sorties (terminées, dans la période
+    de la prévision), groupés par group_column ; jointures externes pour garder
+    les articles sans vente
+    """
+    outgoing_day = func.date(StockOutgoing.outgoing_date)
+    counted = StockOutgoing.id.isnot(None)
+    return db.session.execute(
+        select(
+            group_column.label('group_id'),
+            func.sum(case((counted, StockOutgoingDetail.quantity), else_=0)).label('total_quantity'),
+            func.sum(case(
+                (counted, StockOutgoingDetail.quantity * func.coalesce(StockOutgoingDetail.unit_price_gnf, 0)),
+                else_=0
+            )).label('total_value'),
+            func.count(StockOutgoing.id).label('lines_count')
+        )
+        .select_from(ForecastItem)
+        .join(Forecast, Forecast.id == ForecastItem.forecast_id)
+        .outerjoin(StockOutgoingDetail, StockOutgoingDetail.stock_item_id == ForecastItem.stock_item_id)
+        .outerjoin(StockOutgoing, (StockOutgoing.id == StockOutgoingDetail.outgoing_id)
+                   & (StockOutgoing.status == 'completed')
+                   & (outgoing_day >= Forecast.start_date)
+                   & (outgoing_day <= Forecast.end_date))
+        .where(ForecastItem.forecast_id.in_(forecast_ids))
+        .group_by(group_column)
+    ).all()
+
+
+def realized_sales_for_forecasts(forecast_ids):
+    """
+    Ventes réalisées de chaque article de prévision sur la période de sa prévision
+
+    Returns:
+        dict: {forecast_item_id: stats} (articles sans vente inclus, à zéro)
+    """
+    forecast_ids = list(forecast_ids)
+    if not forecast_ids:
+        return {}
+    return {
+        row.group_id: _stats(row.total_quantity, row.total_value, row.lines_count)
+        for row in _forecast_rows(forecast_ids, ForecastItem.id)
+    }
+
+
+def realized_value_by_forecast(forecast_ids):
+    """Valeur réalisée totale (GNF) par prévision, en une requête"""
+    totals = {forecast_id: Decimal('0') for forecast_id in forecast_ids}
+    if not totals:
+        return totals
+    for row in _forecast_rows(list(totals), ForecastItem.forecast_id):
+        totals[row.group_id] = Decimal(str(row.total_value or 0))
+    return totals
+
+
+def stock_available_by_item(stock_item_ids):
+    """Quantité disponible (dépôts + véhicules) par article, en deux requêtes groupées"""
+    from models import DepotStock, VehicleStock
+
+    stock_item_ids = list(stock_item_ids)
+    available = {stock_item_id: Decimal('0') for stock_item_id in stock_item_ids}
+    if not stock_item_ids:
+        return available
+    for model in (DepotStock, VehicleStock):
+        rows = db.session.execute(
+            select(model.stock_item_id, func.sum(model.quantity))
+            .where(model.stock_item_id.in_(stock_item_ids))
+            .group_by(model.stock_item_id)
+        ).all()
+        for stock_item_id, quantity in rows:
+            available[stock_item_id] += Decimal(str(quantity or 0))
+    return available
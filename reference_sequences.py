@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Attribution des références de documents (PRÉFIXE-AAAAMMJJ-NNNN)
+
+Un compteur par (préfixe, jour) dans la table document_sequences remplace les
+recherches « LIKE 'PRÉFIXE-AAAAMMJJ-%' ORDER BY ... DESC LIMIT 1 » suivies de
+boucles de vérification d'unicité :
+- l'incrément est une seule instruction UPDATE atomique (avec RETURNING quand
+  le dialecte le permet), dans une transaction courte indépendante de celle de
+  l'appelant : le verrou de la ligne compteur n'est tenu que le temps de
+  l'incrément, pas jusqu'au commit du document ;
+- un bloc de numéros peut être réservé en une fois pour les saisies par lot ;
+- à la première utilisation d'un préfixe dans la journée, le compteur part du
+  plus grand numéro déjà présent dans la table du document (références
+  créées avant la mise en place du compteur).
+
+Comme avec une séquence native, les numéros d'une transaction annulée ne sont
+pas réutilisés : la numérotation peut présenter des trous, jamais de doublons.
+"""
+
+import re
+from contextlib import contextmanager
+from datetime import date, datetime, UTC
+
+from sqlalchemy import insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import StaticPool
+
+from models import db, DocumentSequence
+import schema_registry
+
+# Tentatives en cas de création concurrente du compteur du jour
+MAX_ATTEMPTS = 5
+
+# Préfixe -> (table, colonne, référence n'importe où dans la valeur) pour amorcer le compteur
+SEED_SOURCES = {
+    'CMD': ('commercial_orders', 'reference', False),
+    'ENL': ('promotion_sales', 'reference', False),
+    'RET': ('promotion_sales', 'reference', False),
+    'APP': ('promotion_stock_movements', 'notes', True),  # notes « Réf: APP-... »
+}
+for _prefix in ('TRANS', 'REC', 'RET-REC', 'AJUST', 'INV', 'MV'):
+    SEED_SOURCES[_prefix] = ('stock_movements', 'reference', False)
+
+
+def format_reference(prefix, day, number):
+    """PRÉFIXE-AAAAMMJJ-NNNN"""
+    return f"{prefix}-{day.strftime('%Y%m%d')}-{number:04d}"
+
+
+def reserve_references(prefix, count=1, day=None):
+    """
+    Réserve `count` numéros consécutifs pour (préfixe, jour) en une instruction
+
+    Returns:
+        list: Références dans l'ordre croissant
+    """
+    if count < 1:
+        return []
+    day = day or date.today()
+    last_value = _increment(prefix, day, count)
+    return [format_reference(prefix, day, number) for number in range(last_value - count + 1, last_value + 1)]
+
+
+def next_reference(prefix, day=None):
+    """Réserve la prochaine référence du préfixe pour le jour"""
+    return reserve_references(prefix, 1, day)[0]
+
+
+def peek_reference(prefix, day=None):
+    """Prochaine référence probable, sans la réserver (affichage dans les formulaires)"""
+    day = day or date.today()
+    last_value = db.session.execute(
+        select(DocumentSequence.last_value)
+        .where(DocumentSequence.prefix == prefix, DocumentSequence.day == day)
+    ).scalar()
+    if last_value is None:
+        last_value = _seed_value(db.session.connection(), prefix, day)
+    return format_reference(prefix, day, last_value + 1)
+
+
+@contextmanager
+def _transaction():
+    """
+    Transaction courte indépendante de db.session. Une base SQLite en mémoire
+    n'a qu'une connexion partagée (StaticPool) : la transaction de la session
+    est alors utilisée.
+    """
+    if isinstance(db.engine.pool, StaticPool):
+        yield db.session.connection()
+        return
+    with db.engine.begin() as connection:
+        yield connection
+
+
+def _increment(prefix, day, count):
+    for _ in range(MAX_ATTEMPTS):
+        try:
+            with _transaction() as connection:
+                last_value = _update_counter(connection, prefix, day, count)
+                if last_value is None:
+                    last_value = _seed_value(connection, prefix, day) + count
+                    connection.execute(insert(DocumentSequence).values(
+                        prefix=prefix, day=day, last_value=last_value, updated_at=datetime.now(UTC)
+                    ))
+                return last_value
+        except IntegrityError:
+            # Compteur du jour créé en parallèle : on relance l'incrément
+            continue
+    raise RuntimeError(f"Impossible de réserver une référence {prefix} après {MAX_ATTEMPTS} tentatives")
+
+
+def _update_counter(connection, prefix, day, count):
+    """Incrémente le compteur ; None s'il n'existe pas encore"""
+    table = DocumentSequence.__table__
+    statement = (
+        update(table)
+        .where(table.c.prefix == prefix, table.c.day == day)
+        .values(last_value=table.c.last_value + count, updated_at=datetime.now(UTC))
+    )
+    if connection.dialect.update_returning:
+        return connection.execute(statement.returning(table.c.last_value)).scalar()
+    # MySQL : la ligne reste verrouillée par l'UPDATE jusqu'à la fin de la transaction
+    if connection.execute(statement).rowcount == 0:
+        return None
+    return connection.execute(
+        select(table.c.last_value).where(table.c.prefix == prefix, table.c.day == day)
+    ).scalar()
+
+
+def _seed_value(connection, prefix, day):
+    """Plus grand numéro du jour déjà utilisé dans la table du document (0 si aucun)"""
+    source = SEED_SOURCES.get(prefix)
+    if not source or not schema_registry.has_column(source[0], source[1]):
+        return 0
+    table_name, column, anywhere = source
+    stem = format_reference(prefix, day, 0)[:-4]
+    pattern = f"%{stem}%" if anywhere else f"{stem}%"
+    number_pattern = re.compile(re.escape(stem) + r'(\d+)')
+    values = connection.execute(
+        text(f"SELECT {column} FROM {table_name} WHERE {column} LIKE :pattern"), {'pattern': pattern}
+    ).scalars()
+    best = 0
+    for value in values:
+        match = number_pattern.search(value or '')
+        if match:
+            best = max(best, int(match.group(1)))
+    return best
@@ -13,6 +13,7 @@ from models import db, Region, Depot, Vehicle, Family, StockItem, User
 from auth import has_permission, require_permission
 from sqlalchemy.orm import joinedload
 from sqlalchemy import or_
+import export_engine
 from utils_region_filter import (
     filter_depots_by_region, 
     filter_vehicles_by_region,
@@ -645,95 +646,69 @@ def stock_item_new():
     
     return render_template('referentiels/stock_item_form.html', families=families)
 
+STOCK_ITEM_EXPORT_COLUMNS = ['SKU', 'Nom', 'Famille', 'Prix Achat (GNF)', 'Poids (kg)', 'Description',
+                             'Stock Min Dépôt', 'Stock Min Véhicule', 'Actif', 'Date de création',
+                             'Date de modification']
+
+
+@export_engine.exporter('referentiels.stock_items', sheet_name='Articles de Stock', filename='stock_items_export',
+                        columns=STOCK_ITEM_EXPORT_COLUMNS, max_width=50)
+def _export_stock_items(args):
+    """Requête et lignes de l'export des articles (mêmes filtres que stock_items_list)"""
+    search = args.get('search', '').strip()
+    family_filter = args.get('family', '').strip()
+    status_filter = args.get('status', '').strip()
+    
+    query = StockItem.query.options(
+        joinedload(StockItem.family)
+    )
+    
+    # Appliquer les filtres
+    if search:
+        query = query.filter(
+            or_(
+                StockItem.sku.ilike(f'%{search}%'),
+                StockItem.name.ilike(f'%{search}%'),
+                StockItem.description.ilike(f'%{search}%')
+            )
+        )
+    
+    if family_filter:
+        query = query.join(Family).filter(Family.name == family_filter)
+    
+    if status_filter == 'active':
+        query = query.filter_by(is_active=True)
+    elif status_filter == 'inactive':
+        query = query.filter_by(is_active=False)
+    
+    def rows(stock_items):
+        for item in stock_items:
+            yield [
+                item.sku,
+                item.name,
+                item.family.name if item.family else '',
+                float(item.purchase_price_gnf) if item.purchase_price_gnf else 0,
+                float(item.unit_weight_kg) if item.unit_weight_kg else 0,
+                item.description or '',
+                float(item.min_stock_depot) if item.min_stock_depot else 0,
+                float(item.min_stock_vehicle) if item.min_stock_vehicle else 0,
+                'Oui' if item.is_active else 'Non',
+                item.created_at.strftime('%Y-%m-%d %H:%M:%S') if item.created_at else '',
+                item.updated_at.strftime('%Y-%m-%d %H:%M:%S') if item.updated_at else ''
+            ]
+    
+    return query.order_by(StockItem.name, StockItem.id), rows
+
 @referentiels_bp.route('/stock-items/export/excel')
 @login_required
 def stock_items_export_excel():
-    """Export Excel de la liste des articles de stock avec filtres appliqués"""
+    """Export Excel (ou CSV avec format=csv) de la liste des articles de stock avec filtres appliqués"""
     if not has_permission(current_user, 'stock_items.read'):
         flash("Vous n'avez pas la permission d'exporter les données.", "error")
         return redirect(url_for('referentiels.stock_items_list'))
     
-    import pandas as pd
-    from sqlalchemy import or_
-    
-    # Récupérer les mêmes filtres que stock_items_list
-    search = request.args.get('search', '').strip()
-    family_filter = request.args.get('family', '').strip()
-    status_filter = request.args.get('status', '').strip()
-    
     try:
-        # Construire la requête (même logique que stock_items_list)
-        query = StockItem.query.options(
-            joinedload(StockItem.family)
-        )
-        
-        # Appliquer les filtres
-        if search:
-            query = query.filter(
-                or_(
-                    StockItem.sku.ilike(f'%{search}%'),
-                    StockItem.name.ilike(f'%{search}%'),
-                    StockItem.description.ilike(f'%{search}%')
-                )
-            )
-        
-        if family_filter:
-            query = query.join(Family).filter(Family.name == family_filter)
-        
-        if status_filter == 'active':
-            query = query.filter_by(is_active=True)
-        elif status_filter == 'inactive':
-            query = query.filter_by(is_active=False)
-        
-        # Récupérer tous les articles (sans pagination pour l'export)
-        stock_items = query.order_by(StockItem.name).all()
-        
-        # Préparer les données pour Excel
-        data = []
-        for item in stock_items:
-            data.append({
-                'SKU': item.sku,
-                'Nom': item.name,
-                'Famille': item.family.name if item.family else '',
-                'Prix Achat (GNF)': float(item.purchase_price_gnf) if item.purchase_price_gnf else 0,
-                'Poids (kg)': float(item.unit_weight_kg) if item.unit_weight_kg else 0,
-                'Description': item.description or '',
-                'Stock Min Dépôt': float(item.min_stock_depot) if item.min_stock_depot else 0,
-                'Stock Min Véhicule': float(item.min_stock_vehicle) if item.min_stock_vehicle else 0,
-                'Actif': 'Oui' if item.is_active else 'Non',
-                'Date de création': item.created_at.strftime('%Y-%m-%d %H:%M:%S') if item.created_at else '',
-                'Date de modification': item.updated_at.strftime('%Y-%m-%d %H:%M:%S') if item.updated_at else ''
-            })
-        
-        # Créer le DataFrame
-        df = pd.DataFrame(data)
-        
-        # Créer le fichier Excel en mémoire
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Articles de Stock', index=False)
-            
-            # Ajuster la largeur des colonnes
-            worksheet = writer.sheets['Articles de Stock']
-            for idx, col in enumerate(df.columns):
-                max_length = max(
-                    df[col].astype(str).map(len).max(),
-                    len(col)
-                )
-                worksheet.column_dimensions[chr(65 + idx)].width = min(max_length + 2, 50)
-        
-        output.seek(0)
-        
-        # Générer le nom du fichier avec la date
-        filename = f'stock_items_export_{datetime.now(UTC).strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
-    
+        return export_engine.export_response('referentiels.stock_items')
     except Exception as e:
         print(f"❌ Erreur lors de l'export Excel: {e}")
         import traceback
@@ -2,11 +2,14 @@
 # -*- coding: utf-8 -*-
 """
 Routes pour déclencher manuellement les notifications automatiques
+Les envois sont mis en file (job_queue) : la requête ne dépend pas de l'API Message Pro
 """
 
-from flask import Blueprint, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, request, jsonify, flash, redirect, url_for, render_template
 from flask_login import login_required, current_user
-from auth import has_permission
+from auth import has_permission, is_admin
+from models import db
+import job_queue
 
 notifications_bp = Blueprint('notifications', __name__, url_prefix='/notifications')
 
@@ -19,17 +22,13 @@ def envoyer_inventaire_stock():
         return redirect(url_for('index'))
     
     try:
-        from notifications_automatiques import notifications_automatiques
-        
         depot_id = request.form.get('depot_id', type=int) or None
         
-        success = notifications_automatiques.notifier_inventaire_stock(depot_id=depot_id)
-        
-        if success:
-            flash('Inventaire de stock envoyé avec succès', 'success')
-        else:
-            flash('Erreur lors de l\'envoi de l\'inventaire', 'error')
+        job_queue.enqueue('notifications.inventaire_stock', {'depot_id': depot_id})
+        db.session.commit()
+        flash('Envoi de l\'inventaire de stock programmé', 'success')
     except Exception as e:
+        db.session.rollback()
         flash(f'Erreur: {str(e)}', 'error')
         import traceback
         traceback.print_exc()
@@ -45,8 +44,6 @@ def envoyer_situation_stock():
         return redirect(url_for('index'))
     
     try:
-        from notifications_automatiques import notifications_automatiques
-        
         depot_id = request.form.get('depot_id', type=int) or None
         period = request.form.get('period', 'all')
         start_date = request.form.get('start_date') or None
@@ -54,21 +51,20 @@ def envoyer_situation_stock():
         vehicle_id = request.form.get('vehicle_id', type=int) or None
         stock_item_id = request.form.get('stock_item_id', type=int) or None
         
-        success = notifications_automatiques.notifier_situation_stock_periode(
-            depot_id=depot_id,
-            period=period,
-            start_date=start_date,
-            end_date=end_date,
-            vehicle_id=vehicle_id,
-            stock_item_id=stock_item_id
-        )
+        job_queue.enqueue('notifications.situation_stock', {
+            'depot_id': depot_id,
+            'period': period,
+            'start_date': start_date,
+            'end_date': end_date,
+            'vehicle_id': vehicle_id,
+            'stock_item_id': stock_item_id
+        })
+        db.session.commit()
         
-        if success:
-            period_display = period if period != 'all' else 'Toutes périodes'
-            flash(f'Situation de stock ({period_display}) envoyée avec succès par WhatsApp', 'success')
-        else:
-            flash('Erreur lors de l\'envoi de la situation de stock. Vérifiez les logs pour plus de détails.', 'error')
+        period_display = period if period != 'all' else 'Toutes périodes'
+        flash(f'Envoi de la situation de stock ({period_display}) par WhatsApp programmé', 'success')
     except Exception as e:
+        db.session.rollback()
         flash(f'Erreur: {str(e)}', 'error')
         import traceback
         traceback.print_exc()
@@ -89,7 +85,7 @@ def envoyer_rappels_vehicules():
         nb_rappels = envoyer_rappels_vehicules()
         
         if nb_rappels > 0:
-            flash(f'{nb_rappels} rappel(s) véhicules envoyé(s) avec succès', 'success')
+            flash(f'{nb_rappels} rappel(s) véhicules programmé(s)', 'success')
         else:
             flash('Aucun rappel à envoyer', 'info')
     except Exception as e:
@@ -99,3 +95,51 @@ def envoyer_rappels_vehicules():
     
     return redirect(request.referrer or url_for('index'))
 
+
+# =========================================================
+# FILE DE TÂCHES (SUIVI ET FILE DES ÉCHECS)
+# =========================================================
+
+@notifications_bp.route('/jobs')
+@login_required
+def jobs_list():
+    """Suivi de la file de tâches et file des échecs (admin uniquement)"""
+    if not is_admin(current_user):
+        flash('Accès refusé', 'error')
+        return redirect(url_for('index'))
+    
+    status = request.args.get('status', 'dead')
+    if status not in job_queue.STATUSES:
+        status = 'dead'
+    return render_template('notifications/jobs.html',
+                         jobs=job_queue.list_jobs(status=status),
+                         stats=job_queue.stats(),
+                         status=status)
+
+@notifications_bp.route('/jobs/api')
+@login_required
+def jobs_api():
+    """État de la file de tâches (JSON)"""
+    if not is_admin(current_user):
+        return jsonify({'error': 'Accès refusé'}), 403
+    status = request.args.get('status', 'dead')
+    if status not in job_queue.STATUSES:
+        return jsonify({'error': 'Statut inconnu'}), 400
+    return jsonify({
+        'stats': job_queue.stats(),
+        'jobs': [job_queue.job_to_dict(job) for job in job_queue.list_jobs(status=status)]
+    })
+
+@notifications_bp.route('/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+def jobs_retry(job_id):
+    """Relancer une tâche de la file des échecs"""
+    if not is_admin(current_user):
+        flash('Accès refusé', 'error')
+        return redirect(url_for('index'))
+    
+    if job_queue.retry_job(job_id):
+        flash(f'Tâche {job_id} replanifiée', 'success')
+    else:
+        flash(f'La tâche {job_id} n\'est pas dans la file des échecs', 'error')
+    return redirect(url_for('notifications.jobs_list', status='dead'))
@@ -3,39 +3,222 @@
 """
 Module de planification et d'envoi automatique de rapports
 Gère l'envoi automatique de rapports PDF via WhatsApp via Message Pro
+
+Planification sur un cluster (plusieurs workers gunicorn, plusieurs instances) :
+- les tâches APScheduler sont enregistrées dans un stockage partagé (table
+  apscheduler_jobs de la base de l'application) : tout processus peut
+  (dé)planifier un rapport, l'état survit aux redémarrages ;
+- un seul processus, détenteur du bail « scheduled_reports » (table
+  scheduler_leases, renouvelé périodiquement), exécute les déclenchements ;
+  les autres gardent leur planificateur en pause et reprennent le bail s'il
+  expire ;
+- SCHEDULER_ROLE=client : le processus ne brigue jamais le bail (processus web
+  quand un planificateur dédié tourne : `python scheduled_reports.py scheduler`).
+
+Un déclenchement ne fait que mettre l'exécution en file (job_queue) avec une clé
+d'idempotence par créneau : un chevauchement de leaders ne double pas l'envoi.
 """
 
-from flask import Flask
+from flask import Flask, has_app_context
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, UTC
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta, UTC
 from messagepro_api import MessageProAPI
 from pdf_generator import PDFGenerator
 from io import BytesIO
+import argparse
+import atexit
 import os
 import logging
+import signal
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import case, or_, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+import job_queue
 
 logger = logging.getLogger(__name__)
 
+# auto : brigue le bail de leader ; client : planifie dans le stockage partagé sans jamais exécuter
+SCHEDULER_ROLE = os.getenv('SCHEDULER_ROLE', 'auto')
+LEASE_NAME = 'scheduled_reports'
+LEASE_TTL = timedelta(seconds=int(os.getenv('SCHEDULER_LEASE_SECONDS', '60')))
+# Un déclenchement manqué (changement de leader, redémarrage) est rattrapé dans ce délai
+MISFIRE_GRACE_TIME = int(os.getenv('SCHEDULER_MISFIRE_GRACE_SECONDS', '600'))
+JOBS_TABLE = 'apscheduler_jobs'
+
+# Envois simultanés d'un même rapport (bornés aussi par MESSAGEPRO_MAX_CONCURRENCY)
+DELIVERY_CONCURRENCY = int(os.getenv('REPORTS_DELIVERY_CONCURRENCY', '8'))
+# Tentatives par destinataire et délai initial entre deux tentatives (doublé à chaque échec)
+DELIVERY_ATTEMPTS = int(os.getenv('REPORTS_DELIVERY_ATTEMPTS', '3'))
+DELIVERY_RETRY_DELAY = float(os.getenv('REPORTS_DELIVERY_RETRY_DELAY', '2'))
+# Durée de validité de l'index groupe -> numéros (contacts Message Pro)
+GROUP_CACHE_TTL = int(os.getenv('REPORTS_GROUP_CACHE_TTL', '900'))
+CONTACTS_PAGE_SIZE = 500
+CONTACTS_MAX_PAGES = 40
+
+_group_index = {'members': None, 'expires': 0.0}
+_group_index_lock = threading.Lock()
+
+
+def _contact_group_ids(contact):
+    groups = contact.get('groups') or []
+    if isinstance(groups, str):
+        groups = groups.split(',')
+    return {str(group.get('id') if isinstance(group, dict) else group).strip() for group in groups}
+
+
+def group_members(api, group_ids):
+    """
+    Numéros des contacts appartenant aux groupes demandés
+
+    L'API n'expose pas les membres d'un groupe : l'index groupe -> numéros est
+    construit en parcourant les contacts, puis partagé par toutes les exécutions
+    pendant GROUP_CACHE_TTL. Si le rafraîchissement échoue, l'index précédent
+    est conservé.
+    """
+    with _group_index_lock:
+        members = _group_index['members']
+        if members is None or time.monotonic() >= _group_index['expires']:
+            try:
+                members = _load_group_index(api)
+                _group_index.update(members=members, expires=time.monotonic() + GROUP_CACHE_TTL)
+            except Exception as e:
+                logger.error(f"Erreur lors du rafraîchissement des groupes de contacts: {e}")
+                if members is None:
+                    raise
+    phones = []
+    for group_id in group_ids:
+        for phone in members.get(str(group_id).strip(), []):
+            if phone not in phones:
+                phones.append(phone)
+    return phones
+
+
+def clear_group_cache():
+    with _group_index_lock:
+        _group_index.update(members=None, expires=0.0)
+
+
+def _load_group_index(api):
+    members = {}
+    for page in range(1, CONTACTS_MAX_PAGES + 1):
+        result = api.get_contacts(limit=CONTACTS_PAGE_SIZE, page=page)
+        if result.get('status') != 200:
+            raise RuntimeError(result.get('message', 'Erreur inconnue'))
+        contacts = result.get('data') or []
+        if not isinstance(contacts, list):
+            break
+        for contact in contacts:
+            phone = (contact.get('phone') or '').strip()
+            if phone:
+                for group_id in _contact_group_ids(contact):
+                    members.setdefault(group_id, []).append(phone)
+        if len(contacts) < CONTACTS_PAGE_SIZE:
+            break
+    return members
+
 class ScheduledReportsManager:
     """Gestionnaire de rapports automatiques"""
     
     def __init__(self, app: Flask = None):
         self.app = app
-        self.scheduler = BackgroundScheduler()
-        self.scheduler.start()
+        # Démarré par start() : stockage partagé, en pause tant que le processus n'est pas leader
+        self.scheduler = BackgroundScheduler(job_defaults={
+            'coalesce': True, 'max_instances': 1, 'misfire_grace_time': MISFIRE_GRACE_TIME
+        })
         self.pdf_generator = PDFGenerator()
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._lease_thread = None
         
     def init_app(self, app: Flask):
         """Initialise l'application Flask"""
         self.app = app
+    
+    # =========================================================
+    # PLANIFICATEUR PARTAGÉ ET BAIL DE LEADER
+    # =========================================================
+    
+    def start(self, role=None):
+        """Démarre le planificateur sur le stockage partagé (en pause jusqu'à l'obtention du bail)"""
+        from models import db
+        
+        if self.scheduler.running:
+            return
+        role = role or SCHEDULER_ROLE
+        with self._app_context():
+            self.scheduler.add_jobstore(SQLAlchemyJobStore(engine=db.engine, tablename=JOBS_TABLE), 'default')
+        self.scheduler.start(paused=True)
+        atexit.register(self.shutdown)
+        if role == 'auto':
+            self._stop.clear()
+            self._lease_thread = threading.Thread(target=self._lease_loop, name='scheduler-lease', daemon=True)
+            self._lease_thread.start()
+        print(f"✅ Planificateur des rapports démarré (rôle {role}, {self.holder})")
+    
+    def shutdown(self):
+        """Arrête le planificateur et libère le bail (un autre processus le reprend aussitôt)"""
+        self._stop.set()
+        if self._lease_thread is not None:
+            self._lease_thread.join(timeout=5)
+            self._lease_thread = None
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+    
+    def _lease_loop(self):
+        interval = LEASE_TTL.total_seconds() / 3
+        while not self._stop.is_set():
+            self._set_leader(self._try_lease(acquire_lease))
+            self._stop.wait(interval)
+        if self.is_leader:
+            self._try_lease(release_lease)
+            self._set_leader(False)
+    
+    def _try_lease(self, operation):
+        from models import db
+        
+        with self.app.app_context():
+            try:
+                return operation(LEASE_NAME, self.holder)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Erreur sur le bail du planificateur: {e}")
+                return False
+            finally:
+                db.session.remove()
+    
+    def _set_leader(self, leader):
+        if leader and not self.is_leader:
+            self.scheduler.resume()
+            print(f"✅ Planificateur: {self.holder} est leader, exécution des tâches planifiées")
+        elif not leader and self.is_leader:
+            if self.scheduler.running:
+                self.scheduler.pause()
+            print(f"⚠️ Planificateur: {self.holder} n'est plus leader, tâches en pause")
+        elif leader:
+            # Prendre en compte les tâches ajoutées par les autres processus
+            self.scheduler.wakeup()
+        self.is_leader = leader
+    
+    def _app_context(self):
+        """Contexte d'application, sauf s'il y en a déjà un (même session, donc mêmes objets)"""
+        return nullcontext() if has_app_context() else self.app.app_context()
         
     def generate_stock_inventory_pdf(self, depot_id=None, period='all', currency='GNF'):
         """Génère un PDF d'inventaire de stock"""
         from stocks import generate_stock_summary_pdf_data
         from pdf_generator import PDFGenerator
         
-        with self.app.app_context():
+        with self._app_context():
             try:
                 # Générer les données du rapport
                 stock_data = generate_stock_summary_pdf_data(
@@ -72,60 +255,79 @@ class ScheduledReportsManager:
                 traceback.print_exc()
                 return None
     
-    def send_report_via_whatsapp(self, pdf_buffer, recipients, account_id, message="Rapport automatique"):
-        """Envoie un PDF via WhatsApp via Message Pro"""
-        try:
-            api = MessageProAPI()
-            
-            # Convertir le buffer PDF en bytes
-            if hasattr(pdf_buffer, 'getvalue'):
-                pdf_bytes = pdf_buffer.getvalue()
-            elif hasattr(pdf_buffer, 'read'):
-                pdf_bytes = pdf_buffer.read()
-            else:
-                pdf_bytes = pdf_buffer
-            
-            # Nettoyer la liste des destinataires
-            recipients = [r.strip() for r in recipients if r.strip()]
-            
-            # Pour chaque destinataire
-            for recipient in recipients:
+    def send_report_via_whatsapp(self, pdf_buffer, recipients, account_id, message="Rapport automatique", api=None):
+        """
+        Envoie un PDF via WhatsApp via Message Pro à chaque destinataire
+        
+        Les envois partent en parallèle (DELIVERY_CONCURRENCY) et chaque
+        destinataire en échec est retenté avec un délai croissant. L'API ne
+        propose pas de téléversement réutilisable : le PDF est gardé en octets et
+        chaque envoi en lit une copie.
+        
+        Returns:
+            dict: sent, failed, errors (destinataire -> message), duration_ms
+        """
+        started = time.perf_counter()
+        api = api or MessageProAPI()
+        
+        # Convertir le buffer PDF en bytes
+        if hasattr(pdf_buffer, 'getvalue'):
+            pdf_bytes = pdf_buffer.getvalue()
+        elif hasattr(pdf_buffer, 'read'):
+            pdf_bytes = pdf_buffer.read()
+        else:
+            pdf_bytes = pdf_buffer
+        
+        # Nettoyer la liste des destinataires (sans doublons)
+        recipients = list(dict.fromkeys(r.strip() for r in recipients if r and r.strip()))
+        document_name = f"rapport_{datetime.now(UTC).strftime('%Y%m%d_%H%M%S')}.pdf"
+        
+        def deliver(recipient):
+            error = None
+            for attempt in range(1, DELIVERY_ATTEMPTS + 1):
                 try:
-                    # Créer un nouveau BytesIO pour chaque envoi (car il est consommé)
-                    pdf_file = BytesIO(pdf_bytes)
-                    
-                    # Envoyer le document via WhatsApp
                     result = api.send_whatsapp(
                         account=account_id,
-                        recipient=recipient.strip(),
+                        recipient=recipient,
                         message=message,
                         message_type='document',
-                        document_file=pdf_file,
-                        document_name=f"rapport_{datetime.now(UTC).strftime('%Y%m%d_%H%M%S')}.pdf",
+                        document_file=(document_name, BytesIO(pdf_bytes), 'application/pdf'),
+                        document_name=document_name,
                         document_type='pdf',
                         priority=2
                     )
-                    
                     if result.get('status') == 200:
-                        logger.info(f"Rapport envoyé avec succès à {recipient}")
-                    else:
-                        logger.error(f"Erreur lors de l'envoi à {recipient}: {result.get('message')}")
-                        
+                        return None
+                    error = result.get('message') or 'Erreur inconnue'
                 except Exception as e:
-                    logger.error(f"Erreur lors de l'envoi à {recipient}: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    
-        except Exception as e:
-            logger.error(f"Erreur lors de l'envoi du rapport: {e}")
-            import traceback
-            traceback.print_exc()
+                    error = str(e)
+                if attempt < DELIVERY_ATTEMPTS:
+                    time.sleep(DELIVERY_RETRY_DELAY * 2 ** (attempt - 1))
+            return error
+        
+        errors = {}
+        if recipients:
+            with ThreadPoolExecutor(max_workers=max(1, min(DELIVERY_CONCURRENCY, len(recipients))),
+                                    thread_name_prefix='report-delivery') as executor:
+                for recipient, error in zip(recipients, executor.map(deliver, recipients)):
+                    if error:
+                        errors[recipient] = error
+                        logger.error(f"Erreur lors de l'envoi à {recipient}: {error}")
+        
+        summary = {
+            'sent': len(recipients) - len(errors),
+            'failed': len(errors),
+            'errors': errors,
+            'duration_ms': int((time.perf_counter() - started) * 1000)
+        }
+        logger.info(f"Rapport envoyé à {summary['sent']}/{len(recipients)} destinataire(s) en {summary['duration_ms']} ms")
+        return summary
     
     def execute_scheduled_report(self, report_config):
         """Exécute un rapport planifié"""
         from models import ScheduledReport
         
-        with self.app.app_context():
+        with self._app_context():
             try:
                 # Générer le PDF selon le type de rapport
                 pdf_buffer = None
@@ -168,26 +370,16 @@ class ScheduledReportsManager:
                     if report_config.recipients:
                         recipients = [r.strip() for r in report_config.recipients.split(',') if r.strip()]
                     
-                    # Récupérer les membres des groupes
+                    # Récupérer les membres des groupes (index en cache)
+                    api = MessageProAPI()
                     if report_config.group_ids and report_config.group_ids.strip():
-                        api = MessageProAPI()
                         groups = [g.strip() for g in report_config.group_ids.split(',') if g.strip()]
-                        for group_id in groups:
-                            try:
-                                # Récupérer les contacts du groupe
-                                contacts_result = api.get_contacts_by_group(int(group_id), limit=1000, page=1)
-                                if contacts_result and contacts_result.get('status') == 200:
-                                    contacts_data = contacts_result.get('data', [])
-                                    if isinstance(contacts_data, list):
-                                        for contact in contacts_data:
-                                            if contact.get('phone'):
-                                                phone = contact.get('phone').strip()
-                                                if phone and phone not in recipients:
-                                                    recipients.append(phone)
-                            except Exception as e:
-                                logger.error(f"Erreur lors de la récupération du groupe {group_id}: {e}")
-                                import traceback
-                                traceback.print_exc()
+                        try:
+                            for phone in group_members(api, groups):
+                                if phone not in recipients:
+                                    recipients.append(phone)
+                        except Exception as e:
+                            logger.error(f"Erreur lors de la récupération des groupes {groups}: {e}")
                     
                     if not recipients:
                         error_msg = f"Aucun destinataire trouvé pour le rapport {report_config.id}"
@@ -198,22 +390,28 @@ class ScheduledReportsManager:
                         return
                     
                     # Envoyer le rapport
-                    self.send_report_via_whatsapp(
+                    delivery = self.send_report_via_whatsapp(
                         pdf_buffer=pdf_buffer,
                         recipients=recipients,
                         account_id=report_config.whatsapp_account_id,
-                        message=report_config.message or "Rapport automatique"
+                        message=report_config.message or "Rapport automatique",
+                        api=api
                     )
                     
-                    # Mettre à jour la dernière exécution
+                    # Mettre à jour la dernière exécution et ses métriques d'envoi
                     report_config.last_run = datetime.now(UTC)
                     report_config.next_run = self.calculate_next_run(report_config.schedule_type, report_config.schedule)
                     report_config.run_count = (report_config.run_count or 0) + 1
-                    report_config.last_error = None
+                    report_config.last_duration_ms = delivery['duration_ms']
+                    report_config.last_sent_count = delivery['sent']
+                    report_config.last_failed_count = delivery['failed']
+                    report_config.last_error = "; ".join(
+                        f"{recipient}: {error}" for recipient, error in list(delivery['errors'].items())[:10]
+                    )[:2000] or None
                     from models import db
                     db.session.commit()
                     
-                    logger.info(f"Rapport {report_config.id} exécuté avec succès")
+                    logger.info(f"Rapport {report_config.id} exécuté ({delivery['sent']} envoi(s), {delivery['failed']} échec(s))")
                 else:
                     error_msg = f"Impossible de générer le PDF pour le rapport {report_config.id}"
                     logger.error(error_msg)
@@ -307,11 +505,12 @@ class ScheduledReportsManager:
                 logger.error(f"Type de planning non supporté: {report_config.schedule_type}")
                 return False
             
-            # Ajouter la tâche au scheduler
+            # Ajouter la tâche au scheduler : le déclenchement ne fait que mettre
+            # l'exécution en file, la génération et l'envoi tournent dans un worker
             self.scheduler.add_job(
-                func=self.execute_scheduled_report,
+                func='scheduled_reports:declencher_rapport',
                 trigger=trigger,
-                args=[report_config],
+                args=[report_config.id],
                 id=f"report_{report_config.id}",
                 replace_existing=True
             )
@@ -323,6 +522,27 @@ class ScheduledReportsManager:
             logger.error(f"Erreur lors de la planification du rapport {report_config.id}: {e}")
             return False
     
+    def enqueue_scheduled_report(self, report_id):
+        """Déclenchement planifié : met le rapport en file (une exécution par minute planifiée)"""
+        from models import db
+        
+        with self.app.app_context():
+            try:
+                slot = datetime.now(UTC).strftime('%Y%m%d%H%M')
+                job_queue.enqueue('reports.execute', {'report_id': report_id},
+                                  idempotency_key=f"report:{report_id}:{slot}")
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Erreur lors de la mise en file du rapport {report_id}: {e}")
+    
+    def run_vehicle_reminders(self):
+        """Déclenchement planifié des rappels véhicules (dans un contexte d'application)"""
+        from flotte_notifications import envoyer_rappels_vehicules
+        
+        with self.app.app_context():
+            envoyer_rappels_vehicules()
+    
     def unschedule_report(self, report_id):
         """Annule la planification d'un rapport"""
         try:
@@ -336,11 +556,9 @@ class ScheduledReportsManager:
     def schedule_vehicle_reminders(self):
         """Planifie les rappels automatiques pour les véhicules"""
         try:
-            from flotte_notifications import envoyer_rappels_vehicules
-            
-            # Planifier l'exécution quotidienne à 8h00
+            # Planifier l'exécution quotidienne à 8h00 (les envois sont mis en file)
             self.scheduler.add_job(
-                func=envoyer_rappels_vehicules,
+                func='scheduled_reports:declencher_rappels_vehicules',
                 trigger=CronTrigger(hour=8, minute=0),
                 id='vehicle_reminders_daily',
                 name='Rappels documents véhicules',
@@ -351,13 +569,19 @@ class ScheduledReportsManager:
             logger.error(f"Erreur lors de la planification des rappels véhicules: {e}")
     
     def load_all_scheduled_reports(self):
-        """Charge tous les rapports planifiés actifs"""
+        """Démarre le planificateur et synchronise le stockage partagé avec les rapports actifs"""
         from models import ScheduledReport
         
         with self.app.app_context():
+            self.start()
             active_reports = ScheduledReport.query.filter_by(is_active=True).all()
             for report in active_reports:
                 self.schedule_report(report)
+            # Rapports supprimés ou désactivés depuis le dernier chargement
+            active_ids = {f"report_{report.id}" for report in active_reports}
+            for job in self.scheduler.get_jobs():
+                if job.id.startswith('report_') and job.id not in active_ids:
+                    self.scheduler.remove_job(job.id)
             logger.info(f"{len(active_reports)} rapports planifiés chargés")
             
             # Planifier les rappels automatiques véhicules
@@ -366,6 +590,122 @@ class ScheduledReportsManager:
             except Exception as e:
                 logger.error(f"Erreur lors de la planification des rappels véhicules: {e}")
 
+def acquire_lease(name, holder, ttl=None):
+    """
+    Prend ou renouvelle un bail (UPDATE conditionnel : un seul détenteur à la fois)
+
+    Returns:
+        bool: True si `holder` détient le bail jusqu'à maintenant + ttl
+    """
+    from models import db, SchedulerLease
+    
+    now = datetime.now(UTC)
+    expires_at = now + (ttl or LEASE_TTL)
+    result = db.session.execute(
+        update(SchedulerLease)
+        .where(SchedulerLease.name == name,
+               or_(SchedulerLease.holder == holder, SchedulerLease.expires_at < now))
+        .values(expires_at=expires_at, holder=holder,
+                acquired_at=case((SchedulerLease.holder == holder, SchedulerLease.acquired_at), else_=now))
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 1:
+        db.session.commit()
+        return True
+    if db.session.execute(select(SchedulerLease.name).where(SchedulerLease.name == name)).first():
+        db.session.commit()
+        return False
+    try:
+        db.session.add(SchedulerLease(name=name, holder=holder, acquired_at=now, expires_at=expires_at))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        # Créé au même instant par un autre processus
+        db.session.rollback()
+        return False
+
+
+def release_lease(name, holder):
+    """Libère le bail s'il est détenu par `holder`"""
+    from models import db, SchedulerLease
+    
+    result = db.session.execute(
+        update(SchedulerLease)
+        .where(SchedulerLease.name == name, SchedulerLease.holder == holder)
+        .values(expires_at=datetime.now(UTC) - timedelta(seconds=1))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
 # Instance globale
 scheduled_reports_manager = ScheduledReportsManager()
 
+
+# Tâches APScheduler référencées par leur nom (sérialisables dans le stockage partagé)
+def declencher_rapport(report_id):
+    scheduled_reports_manager.enqueue_scheduled_report(report_id)
+
+
+def declencher_rappels_vehicules():
+    scheduled_reports_manager.run_vehicle_reminders()
+
+
+@job_queue.task('reports.execute', queue='reports', max_attempts=3)
+def executer_rapport_planifie(report_id):
+    """Tâche de la file : génère et envoie un rapport planifié"""
+    from models import db, ScheduledReport
+    
+    report = db.session.get(ScheduledReport, report_id)
+    if report is None or not report.is_active:
+        return {'skipped': 'rapport introuvable ou inactif'}
+    scheduled_reports_manager.execute_scheduled_report(report)
+    return {'last_error': report.last_error}
+
+
+def main(argv=None):
+    global SCHEDULER_ROLE
+    parser = argparse.ArgumentParser(description="Planificateur des rapports automatiques")
+    parser.add_argument('command', choices=['scheduler', 'status'])
+    args = parser.parse_args(argv)
+
+    # Le processus planificateur ne fait que mettre en file : pas de worker de tâches intégré
+    job_queue.EMBEDDED_WORKER = False
+    if args.command == 'status':
+        os.environ['DISABLE_SCHEDULER'] = '1'
+    else:
+        os.environ.pop('DISABLE_SCHEDULER', None)
+        SCHEDULER_ROLE = 'auto'
+    from app import app
+    from models import db, SchedulerLease
+
+    if args.command == 'status':
+        with app.app_context():
+            lease = db.session.get(SchedulerLease, LEASE_NAME)
+            print(f"Bail: {lease.holder if lease else 'aucun'} "
+                  f"(expire {lease.expires_at.isoformat() if lease else '-'})")
+            try:
+                for job_id, next_run in db.session.execute(
+                    text(f"SELECT id, next_run_time FROM {JOBS_TABLE} ORDER BY next_run_time")
+                ):
+                    when = datetime.fromtimestamp(next_run, UTC).isoformat() if next_run else 'en pause'
+                    print(f"  {job_id}: {when}")
+            except Exception as e:
+                print(f"⚠️ Stockage des tâches indisponible: {e}")
+        return
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    try:
+        while not stop.wait(3600):
+            pass
+    except KeyboardInterrupt:
+        pass
+    scheduled_reports_manager.shutdown()
+
+
+if __name__ == '__main__':
+    # Passer par le module importé : mêmes références de tâches que les autres processus
+    import scheduled_reports
+    scheduled_reports.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registre des capacités du schéma (tables et colonnes présentes en base)
+
+Chargé une seule fois au démarrage (avant le fork des workers avec preload_app)
+ou après une migration, il répond en O(1) depuis la mémoire à « la table X
+a-t-elle la colonne Y ? » : plus aucun appel à inspect() ni à
+INFORMATION_SCHEMA dans les requêtes HTTP.
+
+Rafraîchissement sur tout le cluster : refresh_cluster() incrémente une version
+partagée dans Redis (REDIS_URL) ; chaque processus la compare au plus une fois
+toutes les SYNC_INTERVAL secondes et se recharge si elle a changé.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, UTC
+
+from sqlalchemy import inspect
+
+from models import db
+
+VERSION_KEY = 'schema_registry:version'
+
+# Intervalle minimal entre deux comparaisons de version avec Redis (secondes)
+SYNC_INTERVAL = int(os.getenv('SCHEMA_REGISTRY_SYNC_INTERVAL', '30'))
+
+_lock = threading.Lock()
+_tables = {}          # {table: (colonnes ordonnées, frozenset des colonnes)}
+_loaded_at = None
+_version = None       # version partagée correspondant au chargement local
+_last_sync = 0.0
+_redis = None
+_redis_checked = False
+
+
+def _get_redis():
+    """Client Redis pour la version partagée (None si REDIS_URL absent ou injoignable)"""
+    global _redis, _redis_checked
+    if not _redis_checked:
+        _redis_checked = True
+        redis_url = os.getenv('REDIS_URL', '')
+        if redis_url and redis_url != 'memory://' and redis_url.startswith(('redis://', 'rediss://')):
+            try:
+                import redis
+                client = redis.Redis.from_url(redis_url, socket_timeout=2)
+                client.ping()
+                _redis = client
+            except Exception as e:
+                print(f"⚠️ Registre du schéma: Redis indisponible ({e}), rafraîchissement limité à ce processus")
+    return _redis
+
+
+def _shared_version():
+    client = _get_redis()
+    if client is None:
+        return None
+    try:
+        value = client.get(VERSION_KEY)
+        return int(value) if value is not None else 0
+    except Exception:
+        return None
+
+
+def load(engine=None):
+    """
+    (Re)charge le registre depuis le catalogue de la base
+
+    Args:
+        engine: Moteur SQLAlchemy (défaut: db.engine, contexte d'application requis)
+
+    Returns:
+        int: Nombre de tables chargées
+    """
+    global _tables, _loaded_at, _version, _last_sync
+    engine = engine if engine is not None else db.engine
+    inspector = inspect(engine)
+
+    tables = {}
+    try:
+        # SQLAlchemy 2.0 : toutes les colonnes en une passe sur le catalogue
+        for (_, table_name), columns in inspector.get_multi_columns().items():
+            names = [col['name'] for col in columns]
+            tables[table_name] = (names, frozenset(names))
+    except (AttributeError, NotImplementedError):
+        for table_name in inspector.get_table_names():
+            names = [col['name'] for col in inspector.get_columns(table_name)]
+            tables[table_name] = (names, frozenset(names))
+
+    version = _shared_version()
+    with _lock:
+        _tables = tables
+        _loaded_at = datetime.now(UTC)
+        _version = version
+        _last_sync = time.monotonic()
+    return len(tables)
+
+
+def _ensure_loaded():
+    """Charge paresseusement le registre et suit la version partagée du cluster"""
+    global _last_sync
+    if _loaded_at is None:
+        load()
+        return
+
+    if time.monotonic() - _last_sync < SYNC_INTERVAL:
+        return
+    _last_sync = time.monotonic()
+    version = _shared_version()
+    if version is not None and version != _version:
+        print(f"🔄 Registre du schéma: version {version} publiée, rechargement")
+        load()
+
+
+def has_table(table_name):
+    """Vrai si la table existe"""
+    _ensure_loaded()
+    return table_name in _tables
+
+
+def has_column(table_name, column_name):
+    """Vrai si la table existe et possède la colonne"""
+    _ensure_loaded()
+    entry = _tables.get(table_name)
+    return entry is not None and column_name in entry[1]
+
+
+def get_columns(table_name):
+    """Colonnes de la table dans l'ordre du catalogue (liste vide si table absente)"""
+    _ensure_loaded()
+    entry = _tables.get(table_name)
+    return list(entry[0]) if entry is not None else []
+
+
+def refresh_cluster(engine=None):
+    """
+    Recharge le registre localement et demande aux autres processus d'en faire autant
+
+    Returns:
+        dict: État du registre après rechargement (voir get_info)
+    """
+    client = _get_redis()
+    if client is not None:
+        try:
+            client.incr(VERSION_KEY)
+        except Exception as e:
+            print(f"⚠️ Registre du schéma: publication de la version impossible ({e})")
+    load(engine)
+    return get_info()
+
+
+def get_info():
+    """État du registre (pour l'administration)"""
+    return {
+        'loaded': _loaded_at is not None,
+        'loaded_at': _loaded_at.isoformat() if _loaded_at else None,
+        'tables_count': len(_tables),
+        'version': _version,
+        'cluster_sync': _get_redis() is not None,
+        'sync_interval': SYNC_INTERVAL,
+    }
+
+
+def reset():
+    """Oublie le registre chargé (tests) : le prochain appel rechargera le catalogue"""
+    global _tables, _loaded_at, _version
+    with _lock:
+        _tables = {}
+        _loaded_at = None
+        _version = None
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rattachement des mouvements de stock existants à leur bon (stock_movement_batches)
+
+Usage:
+    python scripts/backfill_movement_batches.py                 # rattacher les mouvements sans bon
+    python scripts/backfill_movement_batches.py --batch-size 2000
+"""
+
+import argparse
+import os
+import sys
+
+# Ajouter le répertoire parent au path pour importer les modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from config import SQLALCHEMY_DATABASE_URI, SQLALCHEMY_ENGINE_OPTIONS
+from models import db, StockMovementBatch
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = SQLALCHEMY_ENGINE_OPTIONS
+db.init_app(app)
+
+import movement_batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bons de mouvement de stock")
+    parser.add_argument('--batch-size', type=int, default=5000, help="Taille des lots de lecture des mouvements")
+    args = parser.parse_args()
+
+    with app.app_context():
+        # Créer la table si elle n'existe pas encore (la colonne batch_id vient de la migration SQL)
+        StockMovementBatch.__table__.create(bind=db.engine, checkfirst=True)
+
+        print("🔄 Rattachement des mouvements sans bon par référence de base...")
+        attached = movement_batches.backfill_batches(batch_size=args.batch_size)
+        print(f"✅ {attached} mouvement(s) rattaché(s), {StockMovementBatch.query.count()} bon(s) au total")
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la recherche globale : ancienne requête ILIKE '%q%' contre le
+moteur plein texte (search_backend)
+
+Génère un index synthétique (titres, mots-clés et contenus en français
+accentué) puis mesure, pour quelques requêtes, la durée médiane de l'ancienne
+recherche (triple ILIKE + COUNT + tri CASE + score Python) et celle du moteur
+du dialecte (tsvector/GIN, FULLTEXT ou index inversé en mémoire pour SQLite).
+
+Usage:
+    python scripts/benchmark_search.py                             # SQLite en mémoire, 500 000 lignes
+    python scripts/benchmark_search.py --rows 100000
+    python scripts/benchmark_search.py --database-url postgresql://... (base de test vide !)
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import case, insert, or_
+
+from models import db, SearchIndex
+import search_backend
+
+PRODUCTS = ['Réfrigérateur', 'Congélateur', 'Climatiseur', 'Téléviseur', 'Ventilateur', 'Cuisinière',
+            'Machine à laver', 'Micro-ondes', 'Fer à repasser', 'Mixeur', 'Bouilloire', 'Chauffe-eau']
+BRANDS = ['Samsung', 'LG', 'Hisense', 'Beko', 'Nasco', 'Midea', 'Haier', 'Toshiba', 'Sharp', 'Whirlpool']
+WORDS = ['dépôt', 'véhicule', 'réception', 'livraison', 'Conakry', 'Kindia', 'Labé', 'Kankan', 'stock',
+         'commande', 'client', 'prévision', 'garantie', 'économique', 'énergie', 'capacité', 'modèle',
+         'pièce', 'détachée', 'entrepôt', 'transfert', 'inventaire', 'écart', 'retour', 'promotion']
+MODULES = [('stock_item', 'stocks'), ('stock_movement', 'stocks'), ('simulation', 'simulations'),
+           ('forecast', 'forecast'), ('chat_message', 'chat')]
+
+QUERIES = ['refrigerateur', 'Samsung clim', 'livraison kindia', 'télév', 'garantie énergie haier']
+
+
+def seed(rows_count, batch_size=20000):
+    now = datetime.now()
+    for offset in range(0, rows_count, batch_size):
+        rows = []
+        for n in range(offset + 1, min(offset + batch_size, rows_count) + 1):
+            entity_type, module = random.choice(MODULES)
+            product, brand = random.choice(PRODUCTS), random.choice(BRANDS)
+            rows.append({
+                'id': n, 'entity_type': entity_type, 'entity_id': n, 'module': module,
+                'title': f'{product} {brand} {random.randint(100, 999)}',
+                'keywords': f'{brand} {random.choice(WORDS)}',
+                'content': ' '.join(random.choices(WORDS, k=12)),
+                'url': f'/{module}/{n}',
+                'created_at': now - timedelta(minutes=random.randint(0, 365 * 24 * 60)),
+            })
+        db.session.execute(insert(SearchIndex), rows)
+        db.session.commit()
+
+
+def legacy_search(query, limit=50):
+    """Reproduction de l'ancienne recherche (triple ILIKE, COUNT, tri CASE, score Python)"""
+    pattern = f'%{query}%'
+    search_query = SearchIndex.query.filter(or_(
+        SearchIndex.title.ilike(pattern), SearchIndex.keywords.ilike(pattern), SearchIndex.content.ilike(pattern)
+    ))
+    total = search_query.count()
+    results = search_query.order_by(
+        case((SearchIndex.title.ilike(pattern), 1), else_=2), SearchIndex.created_at.desc()
+    ).limit(limit).all()
+    query_lower = query.lower()
+    scored = sorted(
+        results,
+        key=lambda r: (10 if query_lower in (r.title or '').lower() else 0)
+        + (5 if query_lower in (r.keywords or '').lower() else 0)
+        + (1 if query_lower in (r.content or '').lower() else 0),
+        reverse=True
+    )
+    return scored, total
+
+
+def measure(func, query, repeat):
+    durations = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        _, total = func(query)
+        durations.append((time.perf_counter() - started) * 1000)
+    durations.sort()
+    return durations[len(durations) // 2], total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la recherche globale")
+    parser.add_argument('--database-url', default='sqlite:///:memory:')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(42)
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        print(f"🔄 Génération de {args.rows} lignes d'index...")
+        seed(args.rows)
+
+        backend = search_backend.get_backend()
+        started = time.perf_counter()
+        backend.ensure_schema()
+        if backend.name == 'memory':
+            backend.rebuild()
+        print(f"✅ Moteur {backend.name} prêt en {time.perf_counter() - started:.1f} s")
+
+        print(f"{'requête':<26} {'ILIKE (ms)':>11} {'total':>8} {'plein texte (ms)':>17} {'total':>8}")
+        for query in QUERIES:
+            legacy_ms, legacy_total = measure(legacy_search, query, args.repeat)
+            backend_ms, backend_total = measure(lambda q: backend.search(q, limit=50), query, args.repeat)
+            print(f"{query:<26} {legacy_ms:>11.1f} {legacy_total:>8} {backend_ms:>17.1f} {backend_total:>8}")
+
+        if args.database_url.startswith('sqlite'):
+            db.drop_all()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
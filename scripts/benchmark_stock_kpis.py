@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark des KPIs de stock (analytics.compute_stock_kpis)
+
+Génère un jeu de données synthétique (articles, stocks dépôt/véhicule,
+mouvements) par paliers et mesure le temps de calcul des KPIs, global et pour
+une région. Le calcul étant ensembliste, le nombre de requêtes reste constant
+et le temps suit le volume indexé, sans chargement des lignes en Python.
+
+Usage:
+    python scripts/benchmark_stock_kpis.py                        # SQLite en mémoire
+    python scripts/benchmark_stock_kpis.py --sizes 10000 100000 250000
+    python scripts/benchmark_stock_kpis.py --database-url postgresql://... (base de test vide !)
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, date
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event, insert
+
+from models import (
+    db, Region, Role, User, Depot, Vehicle, Family, StockItem, DepotStock,
+    VehicleStock, StockMovement
+)
+import analytics
+
+
+def seed_references(items_count, depots_count, vehicles_count):
+    """Crée régions, dépôts, véhicules, articles et stocks courants"""
+    db.session.add_all([Region(id=1, name='Région A'), Region(id=2, name='Région B')])
+    db.session.add(Role(id=1, name='Bench', code='bench', permissions={}))
+    db.session.add_all([Family(id=1, name='Famille bench')])
+    db.session.flush()
+    db.session.add_all([
+        User(id=i, username=f'bench{i}', email=f'bench{i}@test.local', password_hash='x',
+             role_id=1, region_id=1 + i % 2)
+        for i in range(1, vehicles_count + 1)
+    ])
+    db.session.add_all([Depot(id=i, name=f'Dépôt {i}', region_id=1 + i % 2) for i in range(1, depots_count + 1)])
+    db.session.add_all([
+        Vehicle(id=i, plate_number=f'BN-{i:04d}', current_user_id=i) for i in range(1, vehicles_count + 1)
+    ])
+    db.session.flush()
+    db.session.execute(insert(StockItem), [
+        {'id': i, 'sku': f'SKU-{i:05d}', 'name': f'Article {i}', 'family_id': 1,
+         'purchase_price_gnf': Decimal(random.randint(100, 100000)),
+         'min_stock_depot': Decimal(random.randint(0, 200)), 'min_stock_vehicle': Decimal(random.randint(0, 20)),
+         'is_active': True, 'unit_weight_kg': Decimal('1'), 'created_at': datetime.now()}
+        for i in range(1, items_count + 1)
+    ])
+    db.session.execute(insert(DepotStock), [
+        {'id': d * items_count + i, 'depot_id': d, 'stock_item_id': i,
+         'quantity': Decimal(random.randint(0, 500))}
+        for d in range(1, depots_count + 1) for i in range(1, items_count + 1)
+    ])
+    db.session.execute(insert(VehicleStock), [
+        {'id': v * items_count + i, 'vehicle_id': v, 'stock_item_id': i,
+         'quantity': Decimal(random.randint(0, 50))}
+        for v in range(1, vehicles_count + 1) for i in range(1, items_count + 1)
+    ])
+    db.session.commit()
+
+
+def seed_movements(first_id, count, items_count, depots_count, vehicles_count, batch_size=10000):
+    """Ajoute `count` mouvements répartis sur les 90 derniers jours"""
+    now = datetime.now()
+    for offset in range(0, count, batch_size):
+        rows = []
+        for n in range(first_id + offset, first_id + min(offset + batch_size, count)):
+            quantity = Decimal(random.randint(1, 100))
+            row = {'id': n, 'movement_type': 'transfer', 'stock_item_id': random.randint(1, items_count),
+                   'movement_date': now - timedelta(minutes=random.randint(0, 90 * 24 * 60))}
+            if random.random() < 0.5:
+                row.update({'quantity': quantity, 'to_depot_id': random.randint(1, depots_count)})
+            else:
+                row.update({'quantity': -quantity, 'from_vehicle_id': random.randint(1, vehicles_count)})
+            rows.append(row)
+        db.session.execute(insert(StockMovement), rows)
+        db.session.commit()
+
+
+def measure(region_id, start_date, end_date, repeat):
+    """Durée médiane (ms) et nombre de requêtes d'un calcul de KPIs"""
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            analytics.compute_stock_kpis(start_date, end_date, region_id)
+            durations.append((time.perf_counter() - started) * 1000)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    durations.sort()
+    return durations[len(durations) // 2], len(statements) // repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des KPIs de stock")
+    parser.add_argument('--database-url', default='sqlite:///:memory:')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 100000, 200000],
+                        help="Nombres cumulés de mouvements à mesurer")
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--depots', type=int, default=10)
+    parser.add_argument('--vehicles', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(42)
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        print(f"🔄 Jeu de référence: {args.items} articles, {args.depots} dépôts, {args.vehicles} véhicules")
+        seed_references(args.items, args.depots, args.vehicles)
+
+        start_date = date.today() - timedelta(days=30)
+        end_date = datetime.now() + timedelta(days=1)
+        seeded = 0
+        print(f"{'mouvements':>12} {'global (ms)':>12} {'région (ms)':>12} {'requêtes':>9}")
+        for size in sorted(args.sizes):
+            seed_movements(seeded + 1, size - seeded, args.items, args.depots, args.vehicles)
+            seeded = size
+            global_ms, queries = measure(None, start_date, end_date, args.repeat)
+            region_ms, _ = measure(1, start_date, end_date, args.repeat)
+            print(f"{size:>12} {global_ms:>12.1f} {region_ms:>12.1f} {queries:>9}")
+
+        if args.database_url.startswith('sqlite'):
+            db.drop_all()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
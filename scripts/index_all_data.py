@@ -3,6 +3,10 @@
 """
 Script d'indexation initiale pour le moteur de recherche
 Indexe toutes les données existantes dans la base de données
+
+Exécute le job de réindexation (search_indexer) au premier plan : lots
+validés un par un avec point de reprise, un job interrompu reprend là où il
+s'était arrêté en relançant le script.
 """
 
 import sys
@@ -13,14 +17,17 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from flask import Flask
 from models import db
-from search import (
-    index_article, index_simulation, index_forecast,
-    index_stock_item, index_stock_movement, index_vehicle, index_chat_message
-)
-from models import (
-    Article, Simulation, Forecast, StockItem, StockMovement,
-    Vehicle, ChatMessage
-)
+import search_indexer
+
+LABELS = {
+    'article': 'Articles',
+    'simulation': 'Simulations',
+    'forecast': 'Prévisions',
+    'stock_item': 'Articles de stock',
+    'stock_movement': 'Mouvements',
+    'vehicle': 'Véhicules',
+    'chat_message': 'Messages',
+}
 
 def create_app():
     """Créer l'application Flask"""
@@ -59,109 +66,21 @@ def index_all_data():
             print("🔄 Début de l'indexation...")
             print("=" * 60)
             
-            # Indexer les articles
-            print("\n📦 Indexation des articles...")
-            articles = Article.query.all()
-            count_articles = 0
-            for article in articles:
-                try:
-                    index_article(article)
-                    count_articles += 1
-                except Exception as e:
-                    print(f"  ⚠️  Erreur pour l'article {article.id}: {e}")
-            db.session.commit()
-            print(f"  ✅ {count_articles} article(s) indexé(s)")
-            
-            # Indexer les simulations
-            print("\n🧮 Indexation des simulations...")
-            simulations = Simulation.query.all()
-            count_simulations = 0
-            for simulation in simulations:
-                try:
-                    index_simulation(simulation)
-                    count_simulations += 1
-                except Exception as e:
-                    print(f"  ⚠️  Erreur pour la simulation {simulation.id}: {e}")
-            db.session.commit()
-            print(f"  ✅ {count_simulations} simulation(s) indexée(s)")
-            
-            # Indexer les prévisions
-            print("\n📊 Indexation des prévisions...")
-            forecasts = Forecast.query.all()
-            count_forecasts = 0
-            for forecast in forecasts:
-                try:
-                    index_forecast(forecast)
-                    count_forecasts += 1
-                except Exception as e:
-                    print(f"  ⚠️  Erreur pour la prévision {forecast.id}: {e}")
-            db.session.commit()
-            print(f"  ✅ {count_forecasts} prévision(s) indexée(s)")
-            
-            # Indexer les articles de stock
-            print("\n📦 Indexation des articles de stock...")
-            stock_items = StockItem.query.all()
-            count_stock_items = 0
-            for item in stock_items:
-                try:
-                    index_stock_item(item)
-                    count_stock_items += 1
-                except Exception as e:
-                    print(f"  ⚠️  Erreur pour l'article de stock {item.id}: {e}")
-            db.session.commit()
-            print(f"  ✅ {count_stock_items} article(s) de stock indexé(s)")
-            
-            # Indexer les mouvements de stock
-            print("\n🔄 Indexation des mouvements de stock...")
-            movements = StockMovement.query.all()
-            count_movements = 0
-            for movement in movements:
-                try:
-                    index_stock_movement(movement)
-                    count_movements += 1
-                except Exception as e:
-                    print(f"  ⚠️  Erreur pour le mouvement {movement.id}: {e}")
-            db.session.commit()
-            print(f"  ✅ {count_movements} mouvement(s) indexé(s)")
-            
-            # Indexer les véhicules
-            print("\n🚗 Indexation des véhicules...")
-            vehicles = Vehicle.query.all()
-            count_vehicles = 0
-            for vehicle in vehicles:
-                try:
-                    index_vehicle(vehicle)
-                    count_vehicles += 1
-                except Exception as e:
-                    print(f"  ⚠️  Erreur pour le véhicule {vehicle.id}: {e}")
-            db.session.commit()
-            print(f"  ✅ {count_vehicles} véhicule(s) indexé(s)")
-            
-            # Indexer les messages de chat
-            print("\n💬 Indexation des messages de chat...")
-            messages = ChatMessage.query.all()
-            count_messages = 0
-            for message in messages:
-                try:
-                    index_chat_message(message)
-                    count_messages += 1
-                except Exception as e:
-                    print(f"  ⚠️  Erreur pour le message {message.id}: {e}")
-            db.session.commit()
-            print(f"  ✅ {count_messages} message(s) indexé(s)")
+            db.create_all()  # table des jobs de réindexation
+            job = search_indexer.start_reindex(run_async=False)
+            progress = search_indexer.job_progress(job)
+            if progress['status'] != 'completed':
+                print(f"\n❌ Réindexation {progress['id']} : {progress['status']} {progress['error'] or ''}")
+                print("   Relancez le script pour reprendre au dernier lot validé")
+                return False
             
             print("\n" + "=" * 60)
             print("✅ INDEXATION TERMINÉE AVEC SUCCÈS")
             print("=" * 60)
-            print(f"\n📊 Récapitulatif:")
-            print(f"   • Articles: {count_articles}")
-            print(f"   • Simulations: {count_simulations}")
-            print(f"   • Prévisions: {count_forecasts}")
-            print(f"   • Articles de stock: {count_stock_items}")
-            print(f"   • Mouvements: {count_movements}")
-            print(f"   • Véhicules: {count_vehicles}")
-            print(f"   • Messages: {count_messages}")
-            print(f"\n   Total: {count_articles + count_simulations + count_forecasts + count_stock_items + count_movements + count_vehicles + count_messages} entités indexées")
+            print(f"\n📊 Récapitulatif ({progress['chunks_done']} lot(s)):")
+            for entity_type, count in progress['processed'].items():
+                print(f"   • {LABELS.get(entity_type, entity_type)}: {count}")
+            print(f"\n   Total: {sum(progress['processed'].values())} entités indexées")
             
         except Exception as e:
             db.session.rollback()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test de charge des flux SSE du chat
+
+Ouvre N connexions SSE simultanées (/chat/api/stream/...) et mesure la latence
+d'une page ordinaire avant et pendant la charge. Avec le profil gevent de
+gunicorn.conf.py, la latence doit rester stable quel que soit le nombre de flux.
+
+Usage:
+    python scripts/load_test_sse.py --base-url http://127.0.0.1:8000 \\
+        --username admin --password admin123 --clients 300 --page /stocks/summary
+
+    # Vérifier aussi la diffusion d'un message à tous les flux d'un salon
+    python scripts/load_test_sse.py ... --room-id 1
+
+Code retour 1 si des clients n'ont pas pu se connecter ou si la latence p95
+de la page dépasse --max-slowdown fois la latence de référence.
+"""
+
+import argparse
+import http.client
+import json
+import re
+import statistics
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+
+def login(base_url, username, password):
+    """Ouvre une session authentifiée (formulaire de connexion avec jeton CSRF)"""
+    session = requests.Session()
+    page = session.get(f"{base_url}/auth/login", timeout=30)
+    match = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', page.text)
+    data = {'username': username, 'password': password}
+    if match:
+        data['csrf_token'] = match.group(1)
+    response = session.post(f"{base_url}/auth/login", data=data, timeout=30, allow_redirects=False)
+    if response.status_code not in (302, 303) or 'login' in response.headers.get('Location', ''):
+        raise RuntimeError(f"Connexion refusée pour '{username}' (HTTP {response.status_code})")
+    return session
+
+
+class SSEClient(threading.Thread):
+    """Client SSE minimal (http.client) : garde la connexion ouverte et compte les événements"""
+
+    def __init__(self, base_url, path, cookie_header, stop_event):
+        super().__init__(daemon=True)
+        self.url = urlsplit(base_url)
+        self.path = path
+        self.cookie_header = cookie_header
+        self.stop_event = stop_event
+        self.connected = threading.Event()
+        self.events = {}
+        self.error = None
+
+    def run(self):
+        connection_class = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(self.url.hostname, self.url.port, timeout=60)
+        try:
+            connection.request('GET', self.path, headers={
+                'Accept': 'text/event-stream',
+                'Cookie': self.cookie_header
+            })
+            response = connection.getresponse()
+            if response.status != 200:
+                self.error = f"HTTP {response.status}"
+                return
+            while not self.stop_event.is_set():
+                line = response.fp.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                event_type = json.loads(line[5:]).get('type')
+                self.events[event_type] = self.events.get(event_type, 0) + 1
+                if event_type == 'connected':
+                    self.connected.set()
+        except Exception as e:
+            if not self.stop_event.is_set():
+                self.error = str(e)
+        finally:
+            connection.close()
+
+
+def measure_latency(session, url, samples):
+    durations = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        response = session.get(url, timeout=60)
+        durations.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{url} a répondu HTTP {response.status_code}")
+    durations.sort()
+    return {
+        'p50': statistics.median(durations),
+        'p95': durations[max(0, int(len(durations) * 0.95) - 1)],
+        'max': durations[-1]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge des flux SSE du chat")
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--clients', type=int, default=300, help="Nombre de flux SSE simultanés")
+    parser.add_argument('--room-id', type=int, help="Salon à écouter (sinon flux des conversations)")
+    parser.add_argument('--page', default='/', help="Page ordinaire dont on mesure la latence")
+    parser.add_argument('--samples', type=int, default=30, help="Nombre de requêtes de mesure")
+    parser.add_argument('--connect-timeout', type=float, default=60.0)
+    parser.add_argument('--max-slowdown', type=float, default=2.0, help="Ratio p95 charge / référence toléré")
+    args = parser.parse_args()
+
+    base_url = args.base_url.rstrip('/')
+    session = login(base_url, args.username, args.password)
+    cookie_header = '; '.join(f"{c.name}={c.value}" for c in session.cookies)
+    page_url = f"{base_url}{args.page}"
+    stream_path = f"/chat/api/stream/{args.room_id}" if args.room_id else "/chat/api/stream/rooms"
+
+    print(f"🔄 Latence de référence de {args.page} ({args.samples} requêtes)...")
+    baseline = measure_latency(session, page_url, args.samples)
+    print(f"   p50={baseline['p50']:.1f}ms p95={baseline['p95']:.1f}ms max={baseline['max']:.1f}ms")
+
+    print(f"🔄 Ouverture de {args.clients} flux SSE sur {stream_path}...")
+    stop_event = threading.Event()
+    clients = [SSEClient(base_url, stream_path, cookie_header, stop_event) for _ in range(args.clients)]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    deadline = started + args.connect_timeout
+    for client in clients:
+        client.connected.wait(timeout=max(0.0, deadline - time.perf_counter()))
+    connected = sum(1 for c in clients if c.connected.is_set())
+    print(f"   {connected}/{args.clients} flux connectés en {time.perf_counter() - started:.1f}s")
+
+    print(f"🔄 Latence de {args.page} pendant la charge...")
+    loaded = measure_latency(session, page_url, args.samples)
+    print(f"   p50={loaded['p50']:.1f}ms p95={loaded['p95']:.1f}ms max={loaded['max']:.1f}ms")
+
+    delivered = None
+    if args.room_id:
+        response = session.post(f"{base_url}/chat/api/rooms/{args.room_id}/messages",
+                                data={'content': 'Test de charge SSE'}, timeout=30)
+        response.raise_for_status()
+        time.sleep(2)
+        delivered = sum(1 for c in clients if c.events.get('new_message'))
+        print(f"   Message diffusé à {delivered}/{connected} flux")
+
+    still_open = sum(1 for c in clients if c.is_alive() and not c.error)
+    stop_event.set()
+    errors = [c.error for c in clients if c.error]
+    if errors:
+        print(f"⚠️ {len(errors)} erreur(s) client, ex: {errors[0]}")
+
+    slowdown = loaded['p95'] / baseline['p95'] if baseline['p95'] else 0
+    print(f"📊 Flux ouverts en fin de test: {still_open}/{args.clients} - ralentissement p95: x{slowdown:.2f}")
+
+    ok = connected == args.clients and slowdown <= args.max_slowdown
+    if delivered is not None:
+        ok = ok and delivered == connected
+    print("✅ Test de charge réussi" if ok else "❌ Test de charge échoué")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
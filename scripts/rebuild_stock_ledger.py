@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reconstruction / vérification du grand livre des soldes de stock (stock_balance_ledger)
+
+Usage:
+    python scripts/rebuild_stock_ledger.py            # vérifier puis reconstruire si écart
+    python scripts/rebuild_stock_ledger.py --verify   # vérifier uniquement (code retour 1 si écart)
+    python scripts/rebuild_stock_ledger.py --force    # reconstruire sans vérification préalable
+"""
+
+import argparse
+import os
+import sys
+
+# Ajouter le répertoire parent au path pour importer les modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from config import SQLALCHEMY_DATABASE_URI, SQLALCHEMY_ENGINE_OPTIONS
+from models import db, StockBalanceLedger
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = SQLALCHEMY_ENGINE_OPTIONS
+db.init_app(app)
+
+import stock_ledger
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grand livre des soldes de stock")
+    parser.add_argument('--verify', action='store_true', help="Vérifier uniquement, sans reconstruire")
+    parser.add_argument('--force', action='store_true', help="Reconstruire sans vérification préalable")
+    parser.add_argument('--batch-size', type=int, default=5000, help="Taille des lots de lecture des mouvements")
+    args = parser.parse_args()
+
+    with app.app_context():
+        # Créer la table si elle n'existe pas encore
+        StockBalanceLedger.__table__.create(bind=db.engine, checkfirst=True)
+
+        if not args.force:
+            print("🔄 Vérification du grand livre par rejeu complet de stock_movements...")
+            report = stock_ledger.verify_ledger(batch_size=args.batch_size)
+            print(f"   {report['checked']} clé(s) attendue(s), {len(report['mismatches'])} écart(s)")
+            for mismatch in report['mismatches'][:20]:
+                print(f"   ⚠️  {mismatch['key']} attendu={mismatch['expected']} actuel={mismatch['actual']}")
+
+            if report['ok']:
+                print("✅ Le grand livre est cohérent avec les mouvements")
+                return 0
+            if args.verify:
+                return 1
+
+        print("🔄 Reconstruction du grand livre...")
+        written = stock_ledger.rebuild_ledger(batch_size=args.batch_size)
+        print(f"✅ Grand livre reconstruit: {written} ligne(s)")
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
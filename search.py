@@ -10,327 +10,17 @@ from decimal import Decimal
 import re
 
 from models import (
-    db, SearchIndex, Article, Simulation, SimulationItem, Forecast, ForecastItem,
+    db, SearchIndex, SearchReindexJob, Article, Simulation, SimulationItem, Forecast, ForecastItem,
     StockItem, StockMovement, Depot, Vehicle, User, ChatMessage, ChatRoom,
     Reception, StockOutgoing, PriceList, Family, Region
 )
 from auth import has_permission
+import search_backend
+import search_indexer
 
 # Créer le blueprint
 search_bp = Blueprint('search', __name__, url_prefix='/search')
 
-# =========================================================
-# INDEXATION DES DONNÉES
-# =========================================================
-
-def index_article(article):
-    """Indexe un article"""
-    content_parts = [
-        article.name or '',
-        article.category.name if article.category else '',
-        str(article.purchase_price) if article.purchase_price else '',
-        article.purchase_currency or '',
-    ]
-    content = ' '.join(filter(None, content_parts))
-    
-    keywords = f"{article.name} {article.purchase_currency}"
-    
-    index = SearchIndex.query.filter_by(
-        entity_type='article',
-        entity_id=article.id
-    ).first()
-    
-    if not index:
-        index = SearchIndex(
-            entity_type='article',
-            entity_id=article.id,
-            title=article.name or 'Article sans nom',
-            content=content,
-            keywords=keywords,
-            module='articles',
-            url=f'/articles/{article.id}',
-            search_metadata={
-                'category': article.category.name if article.category else None,
-                'purchase_price': str(article.purchase_price) if article.purchase_price else None,
-                'currency': article.purchase_currency
-            }
-        )
-        db.session.add(index)
-    else:
-        index.title = article.name or 'Article sans nom'
-        index.content = content
-        index.keywords = keywords
-        index.updated_at = datetime.now(UTC)
-    
-    return index
-
-def index_simulation(simulation):
-    """Indexe une simulation avec son nom si disponible"""
-    items = simulation.items or []
-    article_names = [item.article.name for item in items if item.article]
-    
-    # Utiliser le nom de la simulation s'il existe, sinon le numéro
-    simulation_name = getattr(simulation, 'name', None)
-    if simulation_name and simulation_name.strip():
-        title = simulation_name.strip()
-        title_display = title
-    else:
-        title_display = f"Simulation #{simulation.id}"
-        title = title_display
-    
-    content_parts = [
-        title,
-        ' '.join(article_names),
-        f"Taux USD: {simulation.rate_usd}",
-        f"Taux EUR: {simulation.rate_eur}",
-    ]
-    # Ajouter la description si elle existe
-    description = getattr(simulation, 'description', None)
-    if description and description.strip():
-        content_parts.append(description.strip())
-    
-    content = ' '.join(filter(None, content_parts))
-    
-    keywords = f"simulation {simulation.id} {title} {' '.join(article_names)}"
-    
-    index = SearchIndex.query.filter_by(
-        entity_type='simulation',
-        entity_id=simulation.id
-    ).first()
-    
-    if not index:
-        index = SearchIndex(
-            entity_type='simulation',
-            entity_id=simulation.id,
-            title=title_display,
-            content=content,
-            keywords=keywords,
-            module='simulations',
-            url=f'/simulations/{simulation.id}',
-            search_metadata={
-                'name': simulation_name,
-                'rate_usd': str(simulation.rate_usd),
-                'rate_eur': str(simulation.rate_eur),
-                'is_completed': simulation.is_completed,
-                'created_at': simulation.created_at.isoformat() if simulation.created_at else None
-            }
-        )
-        db.session.add(index)
-    else:
-        index.title = title_display
-        index.content = content
-        index.keywords = keywords
-        index.updated_at = datetime.now(UTC)
-        # Mettre à jour les métadonnées avec le nom
-        if index.search_metadata:
-            index.search_metadata['name'] = simulation_name
-        else:
-            index.search_metadata = {'name': simulation_name}
-    
-    return index
-
-def index_forecast(forecast):
-    """Indexe une prévision"""
-    items = forecast.items or []
-    item_names = [item.stock_item.name if item.stock_item else '' for item in items]
-    content_parts = [
-        f"Prévision {forecast.id}",
-        forecast.commercial_name or '',
-        ' '.join(filter(None, item_names)),
-    ]
-    content = ' '.join(filter(None, content_parts))
-    
-    keywords = f"prévision forecast {forecast.commercial_name} {' '.join(filter(None, item_names))}"
-    
-    index = SearchIndex.query.filter_by(
-        entity_type='forecast',
-        entity_id=forecast.id
-    ).first()
-    
-    if not index:
-        index = SearchIndex(
-            entity_type='forecast',
-            entity_id=forecast.id,
-            title=f"Prévision {forecast.commercial_name or f'#{forecast.id}'}",
-            content=content,
-            keywords=keywords,
-            module='forecast',
-            url=f'/forecast/{forecast.id}',
-            search_metadata={
-                'commercial_name': forecast.commercial_name,
-                'period': forecast.period,
-                'created_at': forecast.created_at.isoformat() if forecast.created_at else None
-            }
-        )
-        db.session.add(index)
-    else:
-        index.title = f"Prévision {forecast.commercial_name or f'#{forecast.id}'}"
-        index.content = content
-        index.keywords = keywords
-        index.updated_at = datetime.now(UTC)
-    
-    return index
-
-def index_stock_item(stock_item):
-    """Indexe un article de stock"""
-    content_parts = [
-        stock_item.name or '',
-        stock_item.family.name if stock_item.family else '',
-        stock_item.reference or '',
-        stock_item.description or '',
-    ]
-    content = ' '.join(filter(None, content_parts))
-    
-    keywords = f"{stock_item.name} {stock_item.reference} {stock_item.family.name if stock_item.family else ''}"
-    
-    index = SearchIndex.query.filter_by(
-        entity_type='stock_item',
-        entity_id=stock_item.id
-    ).first()
-    
-    if not index:
-        index = SearchIndex(
-            entity_type='stock_item',
-            entity_id=stock_item.id,
-            title=stock_item.name or 'Article sans nom',
-            content=content,
-            keywords=keywords,
-            module='stocks',
-            url=f'/referentiels/stock-items/{stock_item.id}',
-            search_metadata={
-                'reference': stock_item.reference,
-                'family': stock_item.family.name if stock_item.family else None,
-                'unit': stock_item.unit
-            }
-        )
-        db.session.add(index)
-    else:
-        index.title = stock_item.name or 'Article sans nom'
-        index.content = content
-        index.keywords = keywords
-        index.updated_at = datetime.now(UTC)
-    
-    return index
-
-def index_stock_movement(movement):
-    """Indexe un mouvement de stock"""
-    content_parts = [
-        movement.reference or '',
-        movement.movement_type or '',
-        movement.depot_source.name if movement.depot_source else '',
-        movement.depot_destination.name if movement.depot_destination else '',
-        movement.vehicle.plate_number if movement.vehicle else '',
-    ]
-    content = ' '.join(filter(None, content_parts))
-    
-    keywords = f"{movement.reference} {movement.movement_type}"
-    
-    index = SearchIndex.query.filter_by(
-        entity_type='stock_movement',
-        entity_id=movement.id
-    ).first()
-    
-    if not index:
-        index = SearchIndex(
-            entity_type='stock_movement',
-            entity_id=movement.id,
-            title=f"Mouvement {movement.reference or f'#{movement.id}'}",
-            content=content,
-            keywords=keywords,
-            module='stocks',
-            url=f'/stocks/movements/{movement.id}',
-            search_metadata={
-                'reference': movement.reference,
-                'movement_type': movement.movement_type,
-                'created_at': movement.created_at.isoformat() if movement.created_at else None
-            }
-        )
-        db.session.add(index)
-    else:
-        index.title = f"Mouvement {movement.reference or f'#{movement.id}'}"
-        index.content = content
-        index.keywords = keywords
-        index.updated_at = datetime.now(UTC)
-    
-    return index
-
-def index_vehicle(vehicle):
-    """Indexe un véhicule"""
-    content_parts = [
-        vehicle.plate_number or '',
-        vehicle.brand or '',
-        vehicle.model or '',
-        vehicle.chassis_number or '',
-    ]
-    content = ' '.join(filter(None, content_parts))
-    
-    keywords = f"{vehicle.plate_number} {vehicle.brand} {vehicle.model}"
-    
-    index = SearchIndex.query.filter_by(
-        entity_type='vehicle',
-        entity_id=vehicle.id
-    ).first()
-    
-    if not index:
-        index = SearchIndex(
-            entity_type='vehicle',
-            entity_id=vehicle.id,
-            title=f"Véhicule {vehicle.plate_number or f'#{vehicle.id}'}",
-            content=content,
-            keywords=keywords,
-            module='flotte',
-            url=f'/flotte/vehicles/{vehicle.id}',
-            search_metadata={
-                'plate_number': vehicle.plate_number,
-                'brand': vehicle.brand,
-                'model': vehicle.model,
-                'status': vehicle.status
-            }
-        )
-        db.session.add(index)
-    else:
-        index.title = f"Véhicule {vehicle.plate_number or f'#{vehicle.id}'}"
-        index.content = content
-        index.keywords = keywords
-        index.updated_at = datetime.now(UTC)
-    
-    return index
-
-def index_chat_message(message):
-    """Indexe un message de chat"""
-    content = message.content or ''
-    keywords = f"chat message {message.room.name if message.room else ''}"
-    
-    index = SearchIndex.query.filter_by(
-        entity_type='chat_message',
-        entity_id=message.id
-    ).first()
-    
-    if not index:
-        index = SearchIndex(
-            entity_type='chat_message',
-            entity_id=message.id,
-            title=f"Message dans {message.room.name if message.room else 'Chat'}",
-            content=content,
-            keywords=keywords,
-            module='chat',
-            url=f'/chat/rooms/{message.room_id}/messages#{message.id}',
-            search_metadata={
-                'room_id': message.room_id,
-                'room_name': message.room.name if message.room else None,
-                'sender': message.sender.username if message.sender else None,
-                'created_at': message.created_at.isoformat() if message.created_at else None
-            }
-        )
-        db.session.add(index)
-    else:
-        index.title = f"Message dans {message.room.name if message.room else 'Chat'}"
-        index.content = content
-        index.keywords = keywords
-        index.updated_at = datetime.now(UTC)
-    
-    return index
-
 # =========================================================
 # ROUTES DE RECHERCHE
 # =========================================================
@@ -411,61 +101,14 @@ def api_search():
             if cached_result:
                 return jsonify(cached_result)
         
-        # Construire la requête de recherche optimisée
-        search_query = SearchIndex.query
-        
-        # Recherche améliorée avec scoring de pertinence
-        # Priorité : title > keywords > content
-        query_lower = query.lower()
-        search_pattern = f"%{query}%"
-        
-        # Recherche dans title (priorité haute)
-        title_match = SearchIndex.title.ilike(search_pattern)
-        # Recherche dans keywords (priorité moyenne)
-        keywords_match = SearchIndex.keywords.ilike(search_pattern)
-        # Recherche dans content (priorité basse)
-        content_match = SearchIndex.content.ilike(search_pattern)
-        
-        search_query = search_query.filter(
-            or_(title_match, keywords_match, content_match)
-        )
-        
-        # Filtres par module
-        if modules:
-            search_query = search_query.filter(SearchIndex.module.in_(modules))
-        
-        # Filtres par type d'entité
-        if entity_types:
-            search_query = search_query.filter(SearchIndex.entity_type.in_(entity_types))
-        
-        # Compter le total avant pagination
-        total = search_query.count()
-        
-        # Trier par pertinence (title d'abord, puis date)
-        # Utiliser une expression CASE pour prioriser les matches dans le title
-        search_query = search_query.order_by(
-            case(
-                (SearchIndex.title.ilike(search_pattern), 1),
-                else_=2
-            ),
-            SearchIndex.created_at.desc()
+        # Recherche plein texte : résultats déjà classés par pertinence par le moteur
+        results, total = search_backend.search(
+            query, modules=modules, entity_types=entity_types, limit=limit, offset=offset
         )
         
-        # Pagination
-        results = search_query.offset(offset).limit(limit).all()
-        
-        # Formater les résultats avec scoring
+        # Formater les résultats
         formatted_results = []
-        for result in results:
-            # Calculer un score de pertinence simple
-            score = 0
-            if query_lower in (result.title or '').lower():
-                score += 10
-            if query_lower in (result.keywords or '').lower():
-                score += 5
-            if query_lower in (result.content or '').lower():
-                score += 1
-            
+        for result, score in results:
             # Tronquer le contenu intelligemment
             content = result.content or ''
             if len(content) > 200:
@@ -491,9 +134,6 @@ def api_search():
                 'updated_at': result.updated_at.isoformat() if result.updated_at else None
             })
         
-        # Trier par score décroissant
-        formatted_results.sort(key=lambda x: x['score'], reverse=True)
-        
         response_data = {
             'results': formatted_results,
             'total': total,
@@ -543,24 +183,11 @@ def api_quick_search():
             if cached:
                 return jsonify(cached)
         
-        # Recherche optimisée - priorité au title
-        search_pattern = f"%{query}%"
-        results = SearchIndex.query.filter(
-            or_(
-                SearchIndex.title.ilike(search_pattern),
-                SearchIndex.keywords.ilike(search_pattern)
-            )
-        ).order_by(
-            # Prioriser les matches dans le title
-            case(
-                (SearchIndex.title.ilike(search_pattern), 1),
-                else_=2
-            ),
-            SearchIndex.created_at.desc()
-        ).limit(limit).all()
+        # Recherche par préfixe sur le titre et les mots-clés
+        results, _ = search_backend.search(query, limit=limit, fields='head')
         
         suggestions = []
-        for result in results:
+        for result, _ in results:
             suggestions.append({
                 'title': result.title or 'Sans titre',
                 'module': result.module,
@@ -597,64 +224,53 @@ def get_entity_icon(entity_type):
 @search_bp.route('/api/reindex', methods=['POST'])
 @login_required
 def api_reindex():
-    """Réindexer toutes les données (admin uniquement)"""
-    from flask_login import current_user
+    """
+    Lancer (ou reprendre) la réindexation complète en arrière-plan (admin uniquement)
+
+    L'index est tenu à jour en continu par l'indexation incrémentale : la
+    réindexation complète ne sert qu'à l'initialisation ou à la maintenance.
+    """
     from auth import is_admin
     if not is_admin(current_user):
         return jsonify({'error': 'Accès refusé'}), 403
     
     try:
-        # Indexer les articles
-        articles = Article.query.all()
-        for article in articles:
-            index_article(article)
-        
-        # Indexer les simulations
-        simulations = Simulation.query.all()
-        for simulation in simulations:
-            index_simulation(simulation)
-        
-        # Indexer les prévisions
-        forecasts = Forecast.query.all()
-        for forecast in forecasts:
-            index_forecast(forecast)
-        
-        # Indexer les articles de stock
-        stock_items = StockItem.query.all()
-        for item in stock_items:
-            index_stock_item(item)
-        
-        # Indexer les mouvements de stock
-        movements = StockMovement.query.all()
-        for movement in movements:
-            index_stock_movement(movement)
-        
-        # Indexer les véhicules
-        vehicles = Vehicle.query.all()
-        for vehicle in vehicles:
-            index_vehicle(vehicle)
-        
-        # Indexer les messages de chat
-        messages = ChatMessage.query.all()
-        for message in messages:
-            index_chat_message(message)
-        
-        db.session.commit()
-        
+        data = request.get_json(silent=True) or {}
+        job = search_indexer.start_reindex(
+            entity_types=data.get('entity_types'),
+            requested_by_id=current_user.id
+        )
         return jsonify({
-            'message': 'Indexation terminée avec succès',
-            'articles': len(articles),
-            'simulations': len(simulations),
-            'forecasts': len(forecasts),
-            'stock_items': len(stock_items),
-            'movements': len(movements),
-            'vehicles': len(vehicles),
-            'messages': len(messages)
-        })
+            'message': 'Réindexation lancée en arrière-plan',
+            'job': search_indexer.job_progress(job)
+        }), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@search_bp.route('/api/reindex/status', methods=['GET'])
+@search_bp.route('/api/reindex/<int:job_id>', methods=['GET'])
+@login_required
+def api_reindex_status(job_id=None):
+    """Avancement de la réindexation (dernier job par défaut)"""
+    job = db.session.get(SearchReindexJob, job_id) if job_id else search_indexer.latest_job()
+    if job_id and job is None:
+        return jsonify({'error': 'Job introuvable'}), 404
+    return jsonify({'job': search_indexer.job_progress(job)})
+
+@search_bp.route('/api/reindex/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def api_reindex_cancel(job_id):
+    """Annuler une réindexation (admin uniquement)"""
+    from auth import is_admin
+    if not is_admin(current_user):
+        return jsonify({'error': 'Accès refusé'}), 403
+    if not search_indexer.cancel_job(job_id):
+        return jsonify({'error': 'Aucun job actif avec cet identifiant'}), 404
+    return jsonify({'job': search_indexer.job_progress(db.session.get(SearchReindexJob, job_id))})
+
 @search_bp.route('/api/stats', methods=['GET'])
 @login_required
 def api_stats():
@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Moteur de recherche plein texte de l'index global (table search_index)
+
+Un moteur par dialecte, choisi d'après db.engine :
+- PostgreSQL : colonne générée tsvector pondérée (titre A, mots-clés B,
+  contenu C) avec une configuration française insensible aux accents
+  (unaccent + french_stem), index GIN, classement ts_rank_cd
+- MySQL/MariaDB : index FULLTEXT InnoDB, MATCH ... AGAINST en mode booléen,
+  score pondéré titre/mots-clés
+- SQLite (tests, développement) : index inversé en mémoire, classement BM25F,
+  préfixes par recherche dichotomique dans le vocabulaire trié
+
+Sémantique commune : la requête est normalisée (minuscules, sans accents),
+tous les termes doivent être présents et le dernier terme est un préfixe
+(saisie au fil de l'eau). search() renvoie les lignes déjà classées et le
+total ; les moteurs SQL n'exécutent qu'une requête.
+"""
+
+import heapq
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+
+from sqlalchemy import event, func, literal_column, select, text
+from sqlalchemy.orm import Session
+
+from models import db, SearchIndex
+
+# Nombre maximal de termes pris en compte dans une requête
+MAX_QUERY_TERMS = 8
+
+# Pondération des champs (titre > mots-clés > contenu)
+FIELD_WEIGHTS = {'title': 3.0, 'keywords': 2.0, 'content': 1.0}
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_LIGATURES = str.maketrans({'œ': 'oe', 'æ': 'ae', 'ß': 'ss'})
+
+
+# =========================================================
+# NORMALISATION
+# =========================================================
+
+def normalize(value):
+    """Minuscules sans accents ('Éléphant' → 'elephant')"""
+    value = unicodedata.normalize('NFKD', str(value or '').lower().translate(_LIGATURES))
+    return ''.join(char for char in value if not unicodedata.combining(char))
+
+
+def tokenize(value):
+    return _TOKEN_RE.findall(normalize(value))
+
+
+def query_terms(query):
+    """Termes distincts de la requête, dans l'ordre (le dernier est le préfixe)"""
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+# =========================================================
+# MOTEURS
+# =========================================================
+
+class SearchBackend:
+    """Interface commune des moteurs"""
+    name = 'base'
+
+    def ensure_schema(self):
+        """Crée les structures d'indexation manquantes ; renvoie True si quelque chose a été créé"""
+        return False
+
+    def search(self, query, modules=None, entity_types=None, limit=50, offset=0, fields='all'):
+        """
+        Recherche classée par pertinence (puis date de création décroissante)
+
+        Args:
+            query: Texte saisi
+            modules, entity_types: Filtres optionnels
+            limit, offset: Pagination
+            fields: 'all' (titre, mots-clés, contenu) ou 'head' (titre et mots-clés)
+
+        Returns:
+            tuple: ([(SearchIndex, score)], total)
+        """
+        raise NotImplementedError
+
+    def entities_changed(self, session, entity_type, entity_ids, deleted_row_ids=()):
+        """
+        Signale des lignes écrites par instructions groupées (sans événements ORM)
+
+        Sans effet pour les moteurs SQL : tsvector et FULLTEXT sont tenus à jour par la base.
+        """
+
+    @staticmethod
+    def _filters(modules, entity_types):
+        conditions = []
+        if modules:
+            conditions.append(SearchIndex.module.in_(modules))
+        if entity_types:
+            conditions.append(SearchIndex.entity_type.in_(entity_types))
+        return conditions
+
+    @staticmethod
+    def _paginated(statement, limit, offset):
+        """Exécute une requête (SearchIndex, score, total) et renvoie ([(ligne, score)], total)"""
+        rows = db.session.execute(statement.offset(offset).limit(limit)).all()
+        if not rows:
+            if not offset:
+                return [], 0
+            # Page au-delà des résultats : le total vient d'un comptage séparé
+            total = db.session.execute(
+                select(func.count()).select_from(statement.order_by(None).subquery())
+            ).scalar()
+            return [], int(total or 0)
+        return [(row[0], round(float(row.score or 0), 4)) for row in rows], int(rows[0].total)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """tsvector pondéré + GIN, configuration française sans accents"""
+    name = 'postgresql'
+    TS_CONFIG = 'fr_unaccent'
+    INDEX_NAME = 'idx_search_index_vector'
+
+    def ensure_schema(self):
+        with db.engine.begin() as connection:
+            if connection.execute(text("SELECT to_regclass(:name)"), {'name': self.INDEX_NAME}).scalar():
+                return False
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+            config_exists = connection.execute(
+                text("SELECT 1 FROM pg_ts_config WHERE cfgname = :name"), {'name': self.TS_CONFIG}
+            ).scalar()
+            if not config_exists:
+                connection.execute(text(f"CREATE TEXT SEARCH CONFIGURATION {self.TS_CONFIG} (COPY = french)"))
+                connection.execute(text(
+                    f"ALTER TEXT SEARCH CONFIGURATION {self.TS_CONFIG} "
+                    "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem"
+                ))
+            config = f"'{self.TS_CONFIG}'::regconfig"
+            connection.execute(text(
+                "ALTER TABLE search_index ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                "GENERATED ALWAYS AS ("
+                f"setweight(to_tsvector({config}, coalesce(title, '')), 'A') || "
+                f"setweight(to_tsvector({config}, coalesce(keywords, '')), 'B') || "
+                f"setweight(to_tsvector({config}, coalesce(content, '')), 'C')) STORED"
+            ))
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {self.INDEX_NAME} ON search_index USING GIN (search_vector)"
+            ))
+        return True
+
+    def _tsquery(self, terms, fields):
+        weights = 'AB' if fields == 'head' else ''
+        parts = [f'{term}:{weights}' if weights else term for term in terms[:-1]]
+        parts.append(f'{terms[-1]}:*{weights}')
+        return ' & '.join(parts)
+
+    def search(self, query, modules=None, entity_types=None, limit=50, offset=0, fields='all'):
+        terms = query_terms(query)
+        if not terms:
+            return [], 0
+        vector = literal_column('search_index.search_vector')
+        tsquery = func.to_tsquery(literal_column(f"'{self.TS_CONFIG}'::regconfig"), self._tsquery(terms, fields))
+        # Normalisation 1 : le score est divisé par 1 + log(longueur du document)
+        score = func.ts_rank_cd(vector, tsquery, 1)
+        statement = select(SearchIndex, score.label('score'), func.count().over().label('total'))\
+            .where(vector.op('@@')(tsquery), *self._filters(modules, entity_types))\
+            .order_by(score.desc(), SearchIndex.created_at.desc(), SearchIndex.id.desc())
+        return self._paginated(statement, limit, offset)
+
+
+class MySQLSearchBackend(SearchBackend):
+    """Index FULLTEXT InnoDB (la collation *_ci ignore déjà accents et casse)"""
+    name = 'mysql'
+    INDEXES = {
+        'ft_search_all': ('title', 'keywords', 'content'),
+        'ft_search_head': ('title', 'keywords'),
+    }
+    # innodb_ft_min_token_size : les termes plus courts ne sont pas indexés
+    MIN_TOKEN_SIZE = int(os.getenv('MYSQL_FT_MIN_TOKEN_SIZE', '3'))
+
+    def ensure_schema(self):
+        created = False
+        with db.engine.begin() as connection:
+            existing = set(connection.execute(text(
+                "SELECT DISTINCT index_name FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = 'search_index'"
+            )).scalars())
+            # InnoDB ne crée qu'un index FULLTEXT par instruction
+            for index_name, columns in self.INDEXES.items():
+                if index_name not in existing:
+                    connection.execute(text(
+                        f"ALTER TABLE search_index ADD FULLTEXT INDEX {index_name} ({', '.join(columns)})"
+                    ))
+                    created = True
+        return created
+
+    def _boolean_query(self, terms):
+        required = [f'+{term}' for term in terms[:-1] if len(term) >= self.MIN_TOKEN_SIZE]
+        required.append(f'+{terms[-1]}*')
+        return ' '.join(required)
+
+    def search(self, query, modules=None, entity_types=None, limit=50, offset=0, fields='all'):
+        from sqlalchemy.dialects.mysql import match
+
+        terms = query_terms(query)
+        if not terms:
+            return [], 0
+        against = self._boolean_query(terms)
+        head = match(SearchIndex.title, SearchIndex.keywords, against=against).in_boolean_mode()
+        if fields == 'head':
+            condition, score = head, head
+        else:
+            condition = match(SearchIndex.title, SearchIndex.keywords, SearchIndex.content,
+                              against=against).in_boolean_mode()
+            score = condition + 2 * head
+        statement = select(SearchIndex, score.label('score'), func.count().over().label('total'))\
+            .where(condition, *self._filters(modules, entity_types))\
+            .order_by(score.desc(), SearchIndex.created_at.desc(), SearchIndex.id.desc())
+        return self._paginated(statement, limit, offset)
+
+
+# =========================================================
+# INDEX INVERSÉ EN MÉMOIRE (SQLite / développement)
+# =========================================================
+
+# Intervalle minimal entre deux vérifications de la signature de la table (secondes)
+MEMORY_SYNC_INTERVAL = int(os.getenv('SEARCH_MEMORY_SYNC_INTERVAL', '30'))
+
+# Nombre maximal de termes du vocabulaire développés pour un préfixe
+MAX_PREFIX_EXPANSIONS = 200
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class _InvertedIndex:
+    """
+    Listes inversées compactes : pour chaque terme, les numéros internes de
+    documents et les fréquences pondérées (tous champs / titre et mots-clés)
+    dans des array. Une modification ajoute un nouveau numéro et marque
+    l'ancien comme supprimé ; compact() reconstruit les listes.
+    """
+
+    def __init__(self):
+        self.postings = {}      # terme -> (array docnums, array poids, array poids titre+mots-clés)
+        self.terms = []         # vocabulaire trié pour les préfixes
+        self.doc_ids = []       # docnum -> SearchIndex.id (None si supprimé)
+        self.doc_lengths = array('f')
+        self.doc_modules = []
+        self.doc_types = []
+        self.docnum_by_id = {}
+        self.total_length = 0.0
+        self.deleted = 0
+
+    @property
+    def size(self):
+        return len(self.docnum_by_id)
+
+    def add(self, row_id, title, keywords, content, module, entity_type):
+        self.remove(row_id)
+        weights = {}
+        head_weights = {}
+        length = 0.0
+        for field, value in (('title', title), ('keywords', keywords), ('content', content)):
+            field_weight = FIELD_WEIGHTS[field]
+            for token in tokenize(value):
+                weights[token] = weights.get(token, 0.0) + field_weight
+                if field != 'content':
+                    head_weights[token] = head_weights.get(token, 0.0) + field_weight
+                length += field_weight
+
+        docnum = len(self.doc_ids)
+        self.doc_ids.append(row_id)
+        self.doc_lengths.append(length)
+        self.doc_modules.append(module)
+        self.doc_types.append(entity_type)
+        self.docnum_by_id[row_id] = docnum
+        self.total_length += length
+
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = (array('I'), array('f'), array('f'))
+                insort(self.terms, token)
+            posting[0].append(docnum)
+            posting[1].append(weight)
+            posting[2].append(head_weights.get(token, 0.0))
+
+    def remove(self, row_id):
+        docnum = self.docnum_by_id.pop(row_id, None)
+        if docnum is None:
+            return
+        self.doc_ids[docnum] = None
+        self.total_length -= self.doc_lengths[docnum]
+        self.deleted += 1
+        if self.deleted > 1000 and self.deleted > self.size:
+            self.compact()
+
+    def compact(self):
+        """Retire les documents supprimés des listes inversées (renumérotation)"""
+        renumber = {}
+        doc_ids, doc_lengths, doc_modules, doc_types = [], array('f'), [], []
+        for docnum, row_id in enumerate(self.doc_ids):
+            if row_id is not None:
+                renumber[docnum] = len(doc_ids)
+                doc_ids.append(row_id)
+                doc_lengths.append(self.doc_lengths[docnum])
+                doc_modules.append(self.doc_modules[docnum])
+                doc_types.append(self.doc_types[docnum])
+        postings = {}
+        for token, (docnums, weights, head_weights) in self.postings.items():
+            kept = (array('I'), array('f'), array('f'))
+            for position, docnum in enumerate(docnums):
+                new_docnum = renumber.get(docnum)
+                if new_docnum is not None:
+                    kept[0].append(new_docnum)
+                    kept[1].append(weights[position])
+                    kept[2].append(head_weights[position])
+            if kept[0]:
+                postings[token] = kept
+        self.postings = postings
+        self.terms = sorted(postings)
+        self.doc_ids, self.doc_lengths = doc_ids, doc_lengths
+        self.doc_modules, self.doc_types = doc_modules, doc_types
+        self.docnum_by_id = {row_id: docnum for docnum, row_id in enumerate(doc_ids)}
+        self.deleted = 0
+
+    def _expand(self, term, prefix):
+        if not prefix:
+            return [term] if term in self.postings else []
+        start = bisect_left(self.terms, term)
+        expanded = []
+        for token in self.terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not token.startswith(term):
+                break
+            expanded.append(token)
+        return expanded
+
+    def _term_scores(self, tokens, head_only, candidates):
+        """Scores BM25F d'un terme de la requête (somme sur ses développements de préfixe)"""
+        live = max(self.size, 1)
+        average_length = (self.total_length / live) or 1.0
+        scores = {}
+        for token in tokens:
+            docnums, weights, head_weights = self.postings[token]
+            frequencies = head_weights if head_only else weights
+            idf = math.log(1 + (live - len(docnums) + 0.5) / (len(docnums) + 0.5))
+            for position, docnum in enumerate(docnums):
+                frequency = frequencies[position]
+                if frequency <= 0 or (candidates is not None and docnum not in candidates):
+                    continue
+                if self.doc_ids[docnum] is None:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docnum] / average_length)
+                scores[docnum] = scores.get(docnum, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return scores
+
+    def search(self, terms, modules, entity_types, head_only, count):
+        """Renvoie ([(SearchIndex.id, score)] des `count` meilleurs, total)"""
+        expansions = [self._expand(term, index == len(terms) - 1) for index, term in enumerate(terms)]
+        if not all(expansions):
+            return [], 0
+        # Termes les plus rares d'abord : les candidats diminuent au plus vite
+        expansions.sort(key=lambda tokens: sum(len(self.postings[token][0]) for token in tokens))
+
+        candidates = None
+        for tokens in expansions:
+            term_scores = self._term_scores(tokens, head_only, candidates)
+            if candidates is None:
+                candidates = term_scores
+            else:
+                candidates = {docnum: score + term_scores[docnum]
+                              for docnum, score in candidates.items() if docnum in term_scores}
+            if not candidates:
+                return [], 0
+
+        if modules or entity_types:
+            modules = set(modules or ())
+            entity_types = set(entity_types or ())
+            candidates = {
+                docnum: score for docnum, score in candidates.items()
+                if (not modules or self.doc_modules[docnum] in modules)
+                and (not entity_types or self.doc_types[docnum] in entity_types)
+            }
+        # À score égal, le document indexé le plus récemment d'abord
+        best = heapq.nlargest(count, candidates.items(), key=lambda item: (item[1], item[0]))
+        return [(self.doc_ids[docnum], score) for docnum, score in best], len(candidates)
+
+
+class MemorySearchBackend(SearchBackend):
+    """
+    Index inversé construit depuis search_index au premier appel
+
+    Tenu à jour par les commits de ce processus (événements de session) ;
+    les écritures d'autres processus sont détectées par la signature de la
+    table (nombre de lignes, id et date de mise à jour maximums), vérifiée au
+    plus toutes les MEMORY_SYNC_INTERVAL secondes.
+    """
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._index = None
+        self._engine_id = None
+        self._signature = None
+        self._checked_at = 0.0
+        self._local_changes = False
+
+    def reset(self):
+        with self._lock:
+            self._index = None
+            self._engine_id = None
+            self._signature = None
+
+    def _table_signature(self):
+        return tuple(db.session.execute(
+            select(func.count(SearchIndex.id), func.max(SearchIndex.id), func.max(SearchIndex.updated_at))
+        ).one())
+
+    def rebuild(self):
+        """Reconstruit l'index depuis la table (lecture par lots)"""
+        with self._lock:
+            index = _InvertedIndex()
+            rows = db.session.execute(
+                select(SearchIndex.id, SearchIndex.title, SearchIndex.keywords, SearchIndex.content,
+                       SearchIndex.module, SearchIndex.entity_type)
+                .order_by(SearchIndex.created_at, SearchIndex.id)
+                .execution_options(yield_per=5000)
+            )
+            for row in rows:
+                index.add(*row)
+            self._index = index
+            self._engine_id = id(db.engine)
+            self._signature = self._table_signature()
+            self._checked_at = time.monotonic()
+            self._local_changes = False
+            return index.size
+
+    def _ensure_current(self):
+        if self._index is None or self._engine_id != id(db.engine):
+            self.rebuild()
+            return
+        if time.monotonic() - self._checked_at < MEMORY_SYNC_INTERVAL:
+            return
+        signature = self._table_signature()
+        self._checked_at = time.monotonic()
+        if signature != self._signature:
+            if self._local_changes:
+                # Changements déjà appliqués par ce processus
+                self._signature = signature
+                self._local_changes = False
+            else:
+                self.rebuild()
+
+    def apply_changes(self, changes):
+        """Applique les lignes modifiées d'un commit ({id: valeurs ou None si supprimée})"""
+        with self._lock:
+            if self._index is None:
+                return
+            for row_id, values in changes.items():
+                if values is None:
+                    self._index.remove(row_id)
+                else:
+                    self._index.add(row_id, *values)
+            self._local_changes = True
+
+    def entities_changed(self, session, entity_type, entity_ids, deleted_row_ids=()):
+        if self._index is None:
+            return
+        rows = session.execute(
+            select(SearchIndex.id, SearchIndex.title, SearchIndex.keywords, SearchIndex.content,
+                   SearchIndex.module, SearchIndex.entity_type)
+            .where(SearchIndex.entity_type == entity_type, SearchIndex.entity_id.in_(list(entity_ids)))
+        ).all() if entity_ids else []
+        changes = {row_id: None for row_id in deleted_row_ids}
+        changes.update({row.id: tuple(row[1:]) for row in rows})
+        self.apply_changes(changes)
+
+    def search(self, query, modules=None, entity_types=None, limit=50, offset=0, fields='all'):
+        terms = query_terms(query)
+        if not terms:
+            return [], 0
+        with self._lock:
+            self._ensure_current()
+            ranked, total = self._index.search(terms, modules, entity_types, fields == 'head', offset + limit)
+        ranked = ranked[offset:]
+        if not ranked:
+            return [], total
+        rows = {row.id: row for row in SearchIndex.query.filter(SearchIndex.id.in_([i for i, _ in ranked]))}
+        return [(rows[row_id], round(score, 4)) for row_id, score in ranked if row_id in rows], total
+
+
+# =========================================================
+# SÉLECTION DU MOTEUR
+# =========================================================
+
+_memory_backend = MemorySearchBackend()
+_backends = {
+    'postgresql': PostgresSearchBackend(),
+    'mysql': MySQLSearchBackend(),
+    'mariadb': MySQLSearchBackend(),
+}
+
+
+def get_backend():
+    """Moteur adapté au dialecte de db.engine (index en mémoire par défaut)"""
+    return _backends.get(db.engine.dialect.name, _memory_backend)
+
+
+def ensure_schema():
+    """Crée au démarrage les index plein texte du moteur courant (idempotent)"""
+    return get_backend().ensure_schema()
+
+
+def search(query, modules=None, entity_types=None, limit=50, offset=0, fields='all'):
+    return get_backend().search(query, modules=modules, entity_types=entity_types,
+                                limit=limit, offset=offset, fields=fields)
+
+
+# =========================================================
+# SYNCHRONISATION DE L'INDEX EN MÉMOIRE
+# =========================================================
+
+@event.listens_for(Session, 'after_flush')
+def _track_search_index_changes(session, flush_context):
+    changes = None
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, SearchIndex):
+            if changes is None:
+                changes = session.info.setdefault('search_index_changes', {})
+            if instance in session.deleted:
+                changes[instance.id] = None
+            else:
+                changes[instance.id] = (instance.title, instance.keywords, instance.content,
+                                        instance.module, instance.entity_type)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_search_index_changes(session):
+    changes = session.info.pop('search_index_changes', None)
+    if changes:
+        try:
+            _memory_backend.apply_changes(changes)
+        except Exception as e:
+            print(f"⚠️ Mise à jour de l'index de recherche en mémoire impossible: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _reset_search_index_changes(session):
+    session.info.pop('search_index_changes', None)
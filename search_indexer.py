@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Alimentation de l'index de recherche global (table search_index)
+
+- Indexation incrémentale : les commits qui créent, modifient ou suppriment
+  une entité indexée (article, simulation, prévision, article de stock,
+  mouvement, véhicule, message) mettent à jour ses lignes d'index juste après
+  le commit, dans une transaction courte séparée.
+- Réindexation complète : tâche de la file job_queue, avec un état
+  consultable par l'API (SearchReindexJob), qui parcourt chaque type par pagination sur la clé primaire, écrit les lignes
+  d'index par instructions groupées et valide chaque lot avec son point de
+  reprise : un job interrompu reprend au dernier lot validé.
+"""
+
+import os
+from datetime import datetime, UTC
+
+from sqlalchemy import delete, event, exists, func, insert, select, update
+from sqlalchemy.orm import Session, configure_mappers, joinedload, selectinload
+
+from models import (
+    db, SearchIndex, SearchReindexJob, Article, Simulation, SimulationItem,
+    Forecast, ForecastItem, StockItem, StockMovement, Vehicle, ChatMessage
+)
+import job_queue
+import search_backend
+
+# Taille des lots de la réindexation complète (un commit par lot)
+CHUNK_SIZE = int(os.getenv('SEARCH_REINDEX_CHUNK_SIZE', '500'))
+
+
+# =========================================================
+# DOCUMENTS INDEXÉS
+# =========================================================
+
+def _article_document(article):
+    category = article.category.name if article.category else None
+    return {
+        'title': article.name or 'Article sans nom',
+        'content': ' '.join(filter(None, [
+            article.name, category,
+            str(article.purchase_price) if article.purchase_price else None,
+            article.purchase_currency,
+        ])),
+        'keywords': f"{article.name} {article.purchase_currency}",
+        'module': 'articles',
+        'url': f'/articles/{article.id}',
+        'search_metadata': {
+            'category': category,
+            'purchase_price': str(article.purchase_price) if article.purchase_price else None,
+            'currency': article.purchase_currency
+        }
+    }
+
+
+def _simulation_document(simulation):
+    article_names = [item.article.name for item in simulation.items or [] if item.article]
+    title = f"Simulation #{simulation.id}"
+    return {
+        'title': title,
+        'content': ' '.join(filter(None, [
+            title, ' '.join(article_names),
+            f"Taux USD: {simulation.rate_usd}", f"Taux EUR: {simulation.rate_eur}",
+        ])),
+        'keywords': f"simulation {simulation.id} {' '.join(article_names)}",
+        'module': 'simulations',
+        'url': f'/simulations/{simulation.id}',
+        'search_metadata': {
+            'rate_usd': str(simulation.rate_usd),
+            'rate_eur': str(simulation.rate_eur),
+            'is_completed': simulation.is_completed,
+            'created_at': simulation.created_at.isoformat() if simulation.created_at else None
+        }
+    }
+
+
+def _forecast_document(forecast):
+    item_names = [item.stock_item.name for item in forecast.items or [] if item.stock_item]
+    return {
+        'title': f"Prévision {forecast.name or f'#{forecast.id}'}",
+        'content': ' '.join(filter(None, [
+            f"Prévision {forecast.id}", forecast.name, forecast.commercial_name,
+            forecast.description, ' '.join(item_names),
+        ])),
+        'keywords': f"prévision forecast {forecast.commercial_name or ''} {' '.join(item_names)}",
+        'module': 'forecast',
+        'url': f'/forecast/{forecast.id}',
+        'search_metadata': {
+            'commercial_name': forecast.commercial_name,
+            'period': f"{forecast.start_date.isoformat()} → {forecast.end_date.isoformat()}"
+                      if forecast.start_date and forecast.end_date else None,
+            'status': forecast.status,
+            'created_at': forecast.created_at.isoformat() if forecast.created_at else None
+        }
+    }
+
+
+def _stock_item_document(stock_item):
+    family = stock_item.family.name if stock_item.family else None
+    return {
+        'title': stock_item.name or 'Article sans nom',
+        'content': ' '.join(filter(None, [stock_item.name, family, stock_item.sku, stock_item.description])),
+        'keywords': f"{stock_item.name} {stock_item.sku} {family or ''}",
+        'module': 'stocks',
+        'url': f'/referentiels/stock-items/{stock_item.id}',
+        'search_metadata': {'sku': stock_item.sku, 'family': family}
+    }
+
+
+def _stock_movement_document(movement):
+    return {
+        'title': f"Mouvement {movement.reference or f'#{movement.id}'}",
+        'content': ' '.join(filter(None, [
+            movement.reference, movement.movement_type,
+            movement.stock_item.name if movement.stock_item else None,
+            movement.from_depot.name if movement.from_depot else None,
+            movement.to_depot.name if movement.to_depot else None,
+            movement.from_vehicle.plate_number if movement.from_vehicle else None,
+            movement.to_vehicle.plate_number if movement.to_vehicle else None,
+            movement.supplier_name, movement.bl_number,
+        ])),
+        'keywords': f"{movement.reference or ''} {movement.movement_type}",
+        'module': 'stocks',
+        'url': f'/stocks/movements/{movement.id}',
+        'search_metadata': {
+            'reference': movement.reference,
+            'movement_type': movement.movement_type,
+            'created_at': movement.created_at.isoformat() if movement.created_at else None
+        }
+    }
+
+
+def _vehicle_document(vehicle):
+    return {
+        'title': f"Véhicule {vehicle.plate_number or f'#{vehicle.id}'}",
+        'content': ' '.join(filter(None, [vehicle.plate_number, vehicle.brand, vehicle.model, vehicle.vin])),
+        'keywords': f"{vehicle.plate_number} {vehicle.brand or ''} {vehicle.model or ''}",
+        'module': 'flotte',
+        'url': f'/flotte/vehicles/{vehicle.id}',
+        'search_metadata': {
+            'plate_number': vehicle.plate_number,
+            'brand': vehicle.brand,
+            'model': vehicle.model,
+            'status': vehicle.status
+        }
+    }
+
+
+def _chat_message_document(message):
+    if message.is_deleted:
+        return None  # Les messages supprimés sortent de l'index
+    room_name = message.room.name if message.room else None
+    return {
+        'title': f"Message dans {room_name or 'Chat'}",
+        'content': message.content or '',
+        'keywords': f"chat message {room_name or ''}",
+        'module': 'chat',
+        'url': f'/chat/rooms/{message.room_id}/messages#{message.id}',
+        'search_metadata': {
+            'room_id': message.room_id,
+            'room_name': room_name,
+            'sender': message.sender.username if message.sender else None,
+            'created_at': message.created_at.isoformat() if message.created_at else None
+        }
+    }
+
+
+# Types indexés : (modèle, constructeur du document, options de chargement sans N+1)
+ENTITY_TYPES = {
+    'article': (Article, _article_document, lambda: [joinedload(Article.category)]),
+    'simulation': (Simulation, _simulation_document,
+                   lambda: [selectinload(Simulation.items).joinedload(SimulationItem.article)]),
+    'forecast': (Forecast, _forecast_document,
+                 lambda: [selectinload(Forecast.items).joinedload(ForecastItem.stock_item)]),
+    'stock_item': (StockItem, _stock_item_document, lambda: [joinedload(StockItem.family)]),
+    'stock_movement': (StockMovement, _stock_movement_document, lambda: [
+        joinedload(StockMovement.stock_item), joinedload(StockMovement.from_depot),
+        joinedload(StockMovement.to_depot), joinedload(StockMovement.from_vehicle),
+        joinedload(StockMovement.to_vehicle)
+    ]),
+    'vehicle': (Vehicle, _vehicle_document, lambda: []),
+    'chat_message': (ChatMessage, _chat_message_document,
+                     lambda: [joinedload(ChatMessage.room), joinedload(ChatMessage.sender)]),
+}
+
+_MODEL_TYPES = {model: entity_type for entity_type, (model, _, _) in ENTITY_TYPES.items()}
+
+
+def build_document(entity_type, entity):
+    """Document d'index (title, content, keywords, module, url, search_metadata) ou None"""
+    return ENTITY_TYPES[entity_type][1](entity)
+
+
+def _load_entities(session, entity_type, condition, limit=None):
+    model, _, options = ENTITY_TYPES[entity_type]
+    configure_mappers()  # relations déclarées par backref
+    statement = select(model).options(*options()).where(condition).order_by(model.id)
+    if limit:
+        statement = statement.limit(limit)
+    return session.scalars(statement).unique().all()
+
+
+def upsert_documents(session, entity_type, entities, entity_ids=None):
+    """
+    Écrit les lignes d'index d'un lot d'entités en instructions groupées
+
+    Une requête pour les lignes existantes, puis UPDATE groupé par clé
+    primaire, INSERT groupé et DELETE des lignes sans document (entité
+    supprimée ou exclue). entity_ids permet de retirer les entités absentes
+    du lot (supprimées entre-temps).
+
+    Returns:
+        dict: {'inserted', 'updated', 'deleted'}
+    """
+    documents = {entity.id: build_document(entity_type, entity) for entity in entities}
+    for entity_id in entity_ids or ():
+        documents.setdefault(entity_id, None)
+    if not documents:
+        return {'inserted': 0, 'updated': 0, 'deleted': 0}
+
+    existing = {}
+    for row_id, entity_id in session.execute(
+        select(SearchIndex.id, SearchIndex.entity_id)
+        .where(SearchIndex.entity_type == entity_type, SearchIndex.entity_id.in_(list(documents)))
+    ):
+        existing.setdefault(entity_id, []).append(row_id)
+
+    now = datetime.now(UTC)
+    inserts, updates, deleted_ids = [], [], []
+    for entity_id, document in documents.items():
+        row_ids = existing.get(entity_id, [])
+        if document is None:
+            deleted_ids.extend(row_ids)
+            continue
+        if row_ids:
+            updates.append({'id': row_ids[0], **document, 'updated_at': now})
+            deleted_ids.extend(row_ids[1:])  # doublons hérités de l'ancienne indexation
+        else:
+            inserts.append({'entity_type': entity_type, 'entity_id': entity_id, **document, 'created_at': now})
+
+    if updates:
+        session.execute(update(SearchIndex), updates)
+    if inserts:
+        session.execute(insert(SearchIndex), inserts)
+    if deleted_ids:
+        session.execute(delete(SearchIndex).where(SearchIndex.id.in_(deleted_ids)))
+
+    search_backend.get_backend().entities_changed(
+        session, entity_type, [entity_id for entity_id, document in documents.items() if document],
+        deleted_ids
+    )
+    return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deleted_ids)}
+
+
+def index_entities(session, entity_type, entity_ids):
+    """(Ré)indexe des entités par identifiant ; les entités introuvables sont retirées de l'index"""
+    entity_ids = sorted(set(entity_ids))
+    model = ENTITY_TYPES[entity_type][0]
+    entities = _load_entities(session, entity_type, model.id.in_(entity_ids)) if entity_ids else []
+    return upsert_documents(session, entity_type, entities, entity_ids)
+
+
+def purge_orphans(session, entity_type, batch_size=1000):
+    """Supprime les lignes d'index dont l'entité n'existe plus"""
+    model = ENTITY_TYPES[entity_type][0]
+    orphan_ids = session.scalars(
+        select(SearchIndex.id).where(
+            SearchIndex.entity_type == entity_type,
+            ~exists().where(model.id == SearchIndex.entity_id)
+        )
+    ).all()
+    for start in range(0, len(orphan_ids), batch_size):
+        session.execute(delete(SearchIndex).where(SearchIndex.id.in_(orphan_ids[start:start + batch_size])))
+    if orphan_ids:
+        search_backend.get_backend().entities_changed(session, entity_type, [], orphan_ids)
+    return len(orphan_ids)
+
+
+# =========================================================
+# RÉINDEXATION COMPLÈTE (JOB PAR LOTS, REPRENABLE)
+# =========================================================
+
+def job_progress(job):
+    """État d'un job pour l'API (avancement global en pourcentage)"""
+    if job is None:
+        return None
+    processed = job.processed or {}
+    totals = job.totals or {}
+    total = sum(totals.values())
+    done = sum(processed.values())
+    percent = 100.0 if job.status == 'completed' else (round(min(done / total, 1) * 100, 1) if total else 0.0)
+    return {
+        'id': job.id,
+        'status': job.status,
+        'entity_types': job.entity_types,
+        'current_entity_type': job.current_entity_type,
+        'last_entity_id': job.last_entity_id,
+        'processed': processed,
+        'totals': totals,
+        'percent': percent,
+        'chunks_done': job.chunks_done,
+        'error': job.error,
+        'stale': job_queue.record_abandoned(job),
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'heartbeat_at': job.heartbeat_at.isoformat() if job.heartbeat_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def latest_job():
+    return db.session.scalars(
+        select(SearchReindexJob).order_by(SearchReindexJob.id.desc()).limit(1)
+    ).first()
+
+
+def start_reindex(entity_types=None, requested_by_id=None, run_async=True):
+    """
+    Lance (ou reprend) une réindexation complète
+
+    Un job actif et vivant est renvoyé tel quel ; un job abandonné ou en
+    échec reprend à son point de reprise ; sinon un nouveau job est créé.
+
+    Args:
+        entity_types: Types à indexer (défaut: tous)
+        requested_by_id: Utilisateur à l'origine de la demande
+        run_async: True pour exécuter par la file de tâches (job_queue), False pour exécuter immédiatement
+
+    Returns:
+        SearchReindexJob
+    """
+    entity_types = [t for t in (entity_types or ENTITY_TYPES) if t in ENTITY_TYPES]
+    if not entity_types:
+        raise ValueError("Aucun type d'entité indexable")
+
+    job = latest_job()
+    if job is not None and job.status in job_queue.RECORD_ACTIVE_STATUSES and not job_queue.record_abandoned(job):
+        return job
+    if job is None or job.status not in job_queue.RECORD_ACTIVE_STATUSES + ('failed',):
+        job = SearchReindexJob(
+            status='pending',
+            entity_types=entity_types,
+            current_entity_type=entity_types[0],
+            last_entity_id=0,
+            processed={entity_type: 0 for entity_type in entity_types},
+            totals={
+                entity_type: db.session.execute(select(func.count(ENTITY_TYPES[entity_type][0].id))).scalar() or 0
+                for entity_type in entity_types
+            },
+            requested_by_id=requested_by_id
+        )
+        db.session.add(job)
+        db.session.flush()
+    else:
+        job.status = 'pending'
+    if run_async:
+        job_queue.enqueue_for(job, 'search.reindex', {'job_id': job.id})
+        db.session.commit()
+        return job
+    db.session.commit()
+    run_job(job.id)
+    db.session.refresh(job)
+    return job
+
+
+def run_job(job_id, chunk_size=None):
+    """
+    Exécute un job depuis son point de reprise
+
+    Chaque lot (pagination par clé sur l'identifiant de l'entité) est écrit
+    puis validé avec le point de reprise dans la même transaction.
+
+    Returns:
+        bool: True si le job a été exécuté jusqu'au bout par cet appel
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    if not job_queue.claim_record(SearchReindexJob, job_id):
+        return False
+
+    job = db.session.get(SearchReindexJob, job_id)
+    try:
+        types = job.entity_types
+        position = types.index(job.current_entity_type) if job.current_entity_type in types else 0
+        for entity_type in types[position:]:
+            model = ENTITY_TYPES[entity_type][0]
+            if job.current_entity_type != entity_type:
+                job.current_entity_type = entity_type
+                job.last_entity_id = 0
+            while True:
+                entities = _load_entities(db.session, entity_type, model.id > job.last_entity_id, chunk_size)
+                if not entities:
+                    break
+                upsert_documents(db.session, entity_type, entities)
+                job.last_entity_id = entities[-1].id
+                job.processed = {**(job.processed or {}),
+                                 entity_type: (job.processed or {}).get(entity_type, 0) + len(entities)}
+                job.chunks_done = (job.chunks_done or 0) + 1
+                job.heartbeat_at = datetime.now(UTC)
+                db.session.commit()
+                # La carte d'identité est faible : le lot est libéré à l'itération suivante
+                del entities
+                if job.status == 'cancelled':  # relu après le commit (annulation par l'API)
+                    print(f"⚠️ Réindexation {job_id} annulée")
+                    return False
+            purge_orphans(db.session, entity_type)
+            db.session.commit()
+
+        job.status = 'completed'
+        job.finished_at = datetime.now(UTC)
+        db.session.commit()
+        print(f"✅ Réindexation {job_id} terminée ({sum((job.processed or {}).values())} entités)")
+        return True
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Erreur lors de la réindexation {job_id}: {e}")
+        job = db.session.get(SearchReindexJob, job_id)
+        if job is not None:
+            job.status = 'failed'
+            job.error = str(e)[:2000]
+            db.session.commit()
+        return False
+
+
+def cancel_job(job_id):
+    """Demande l'arrêt d'un job (pris en compte à la fin du lot en cours)"""
+    result = db.session.execute(
+        update(SearchReindexJob)
+        .where(SearchReindexJob.id == job_id,
+               SearchReindexJob.status.in_(job_queue.RECORD_ACTIVE_STATUSES + ('failed',)))
+        .values(status='cancelled', finished_at=datetime.now(UTC))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+@job_queue.task('search.reindex', queue='search')
+def reindex_task(job_id):
+    """Tâche de la file : un échec est enregistré dans le job, qui reprend à son point de reprise"""
+    return {'completed': run_job(job_id)}
+
+
+# =========================================================
+# INDEXATION INCRÉMENTALE SUR MODIFICATION DES ENTITÉS
+# =========================================================
+
+def _changed_keys(instance):
+    """(type, id) à réindexer pour une instance modifiée (les lignes réindexent leur parent)"""
+    entity_type = _MODEL_TYPES.get(type(instance))
+    if entity_type is not None:
+        return [(entity_type, instance.id)]
+    if isinstance(instance, SimulationItem) and instance.simulation_id:
+        return [('simulation', instance.simulation_id)]
+    if isinstance(instance, ForecastItem) and instance.forecast_id:
+        return [('forecast', instance.forecast_id)]
+    return []
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_indexed_changes(session, flush_context):
+    keys = None
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        for key in _changed_keys(instance):
+            if key[1] is None:
+                continue
+            if keys is None:
+                keys = session.info.setdefault('search_index_pending', set())
+            keys.add(key)
+
+
+def mark_for_indexing(session, entity_type, entity_ids):
+    """Réindexe après le commit des entités écrites hors ORM (insertions groupées)"""
+    keys = session.info.setdefault('search_index_pending', set())
+    keys.update((entity_type, entity_id) for entity_id in entity_ids if entity_id is not None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _index_after_commit(session):
+    keys = session.info.pop('search_index_pending', None)
+    if not keys:
+        return
+    try:
+        by_type = {}
+        for entity_type, entity_id in keys:
+            by_type.setdefault(entity_type, set()).add(entity_id)
+        # La session qui vient de valider ne peut plus émettre de SQL ici : transaction séparée
+        with Session(bind=db.engine) as index_session:
+            for entity_type, entity_ids in by_type.items():
+                index_entities(index_session, entity_type, entity_ids)
+            index_session.commit()
+    except Exception as e:
+        print(f"⚠️ Indexation incrémentale de la recherche impossible: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _reset_indexed_changes(session):
+    session.info.pop('search_index_pending', None)
@@ -47,6 +47,11 @@ class ChatSSE {
                     }
                     
                     this.onMessage(data);
+                } else if (data.type === 'message_updated' || data.type === 'message_deleted') {
+                    // Modification / suppression faite depuis un autre onglet ou par un autre membre
+                    if (typeof updateMessageInUI === 'function') {
+                        updateMessageInUI(data.id, data.content, data.is_edited);
+                    }
                 } else if (data.type === 'heartbeat') {
                     // Heartbeat pour maintenir la connexion
                     console.log('💓 Heartbeat SSE');
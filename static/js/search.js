@@ -173,10 +173,13 @@ function displayResults(data) {
         </div>
     `;
     
+    // L'échelle du score dépend du moteur : on compare au meilleur résultat de la page
+    const bestScore = data.results.length ? data.results[0].score : 0;
+    
     data.results.forEach((result, index) => {
         const moduleBadge = getModuleBadge(result.module);
         const typeIcon = getTypeIcon(result.entity_type);
-        const scoreBadge = result.score > 5 ? `<span style="background: var(--color-success); color: white; padding: 0.25rem 0.5rem; border-radius: 8px; font-size: 0.75rem; margin-left: 0.5rem;">Pertinent</span>` : '';
+        const scoreBadge = bestScore > 0 && result.score >= bestScore * 0.8 ? `<span style="background: var(--color-success); color: white; padding: 0.25rem 0.5rem; border-radius: 8px; font-size: 0.75rem; margin-left: 0.5rem;">Pertinent</span>` : '';
         
         html += `
             <div class="result-item" 
@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Grand livre matérialisé des soldes de stock
+
+La table stock_balance_ledger agrège les mouvements de stock par
+(emplacement, article, type de mouvement, jour). Elle est maintenue de façon
+incrémentale par des listeners SQLAlchemy sur StockMovement (création,
+modification, suppression - y compris les mouvements générés par la
+validation d'inventaire), dans la même transaction que le mouvement.
+
+Les récapitulatifs de stock interrogent ce grand livre avec quelques requêtes
+agrégées au lieu de rejouer les mouvements article par article.
+
+La table stock_movement_daily_counts (nombre de mouvements par jour et par
+type) est maintenue par les mêmes listeners : compteurs et tendance de la
+liste des mouvements sans COUNT(*) sur stock_movements.
+
+Règle de calcul (identique à l'ancien rejeu des mouvements) :
+- si l'emplacement est la destination (to_*) : entrée = quantité du mouvement
+- sinon, s'il est la source (from_*) : sortie = valeur absolue de la quantité
+"""
+
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import event, select, and_, or_, false, func
+
+from models import db, StockMovement, StockBalanceLedger, StockMovementDailyCount
+
+LOCATION_DEPOT = 'depot'
+LOCATION_VEHICLE = 'vehicle'
+
+# Colonnes de StockMovement qui influencent le grand livre
+LEDGER_FIELDS = (
+    'stock_item_id', 'movement_type', 'movement_date', 'quantity',
+    'from_depot_id', 'to_depot_id', 'from_vehicle_id', 'to_vehicle_id',
+)
+
+_KEY_COLUMNS = ('location_type', 'location_id', 'stock_item_id', 'movement_type', 'day')
+_DAILY_KEY_COLUMNS = ('day', 'movement_type')
+
+
+def _to_day(value):
+    """Convertit une date/datetime (ou None) en date"""
+    if value is None:
+        return date.today()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    # SQLite peut renvoyer des chaînes
+    return datetime.fromisoformat(str(value)).date()
+
+
+def _to_decimal(value):
+    if value is None:
+        return Decimal('0')
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def movement_contributions(row):
+    """
+    Calcule les contributions d'un mouvement au grand livre
+
+    Args:
+        row: objet ou mapping exposant les colonnes de LEDGER_FIELDS
+
+    Returns:
+        list: tuples (clé, quantity_in, quantity_out) où clé suit _KEY_COLUMNS
+    """
+    get = row.get if isinstance(row, dict) else (lambda name: getattr(row, name, None))
+    stock_item_id = get('stock_item_id')
+    if stock_item_id is None:
+        return []
+
+    quantity = _to_decimal(get('quantity'))
+    movement_type = get('movement_type') or 'transfer'
+    day = _to_day(get('movement_date'))
+
+    contributions = []
+    for location_type, to_id, from_id in (
+        (LOCATION_DEPOT, get('to_depot_id'), get('from_depot_id')),
+        (LOCATION_VEHICLE, get('to_vehicle_id'), get('from_vehicle_id')),
+    ):
+        # Transfert sur une seule ligne (source et destination renseignées) :
+        # crédit de la destination et débit de la source, comme l'ancien recalcul par dépôt
+        if to_id:
+            key = (location_type, int(to_id), int(stock_item_id), movement_type, day)
+            contributions.append((key, quantity, Decimal('0')))
+        if from_id and from_id != to_id:
+            key = (location_type, int(from_id), int(stock_item_id), movement_type, day)
+            contributions.append((key, Decimal('0'), abs(quantity)))
+    return contributions
+
+
+def aggregate_contributions(rows, sign=1):
+    """Regroupe les contributions d'une liste de mouvements par clé du grand livre"""
+    totals = defaultdict(lambda: [Decimal('0'), Decimal('0'), 0])
+    for row in rows:
+        for key, qty_in, qty_out in movement_contributions(row):
+            bucket = totals[key]
+            bucket[0] += qty_in * sign
+            bucket[1] += qty_out * sign
+            bucket[2] += sign
+    return totals
+
+
+def _upsert_statement(connection):
+    """
+    Construit un INSERT ... ON CONFLICT/DUPLICATE KEY qui additionne les deltas
+    (sans valeurs : exécuté avec une liste de lignes en une seule instruction groupée)
+    """
+    table = StockBalanceLedger.__table__
+    dialect = connection.dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table)
+        return stmt.on_duplicate_key_update(
+            quantity_in=table.c.quantity_in + stmt.inserted.quantity_in,
+            quantity_out=table.c.quantity_out + stmt.inserted.quantity_out,
+            movements_count=table.c.movements_count + stmt.inserted.movements_count,
+        )
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=list(_KEY_COLUMNS),
+            set_={
+                'quantity_in': table.c.quantity_in + stmt.excluded.quantity_in,
+                'quantity_out': table.c.quantity_out + stmt.excluded.quantity_out,
+                'movements_count': table.c.movements_count + stmt.excluded.movements_count,
+            },
+        )
+
+    return None
+
+
+def apply_deltas(connection, totals):
+    """
+    Applique des deltas agrégés au grand livre (upsert additif)
+
+    Args:
+        connection: connexion SQLAlchemy (celle de la transaction en cours)
+        totals: dict clé -> [quantity_in, quantity_out, movements_count]
+    """
+    table = StockBalanceLedger.__table__
+    rows = []
+    for key, (qty_in, qty_out, count) in totals.items():
+        if qty_in == 0 and qty_out == 0 and count == 0:
+            continue
+        values = dict(zip(_KEY_COLUMNS, key))
+        values.update(quantity_in=qty_in, quantity_out=qty_out, movements_count=count)
+        rows.append(values)
+    if not rows:
+        return
+
+    stmt = _upsert_statement(connection)
+    if stmt is not None:
+        # Une instruction groupée, quel que soit le nombre de clés touchées
+        connection.execute(stmt, rows)
+        return
+
+    # Dialecte sans upsert natif : UPDATE puis INSERT si la ligne n'existe pas
+    for values in rows:
+        key_filter = and_(*[table.c[col] == values[col] for col in _KEY_COLUMNS])
+        result = connection.execute(
+            table.update().where(key_filter).values(
+                quantity_in=table.c.quantity_in + values['quantity_in'],
+                quantity_out=table.c.quantity_out + values['quantity_out'],
+                movements_count=table.c.movements_count + values['movements_count'],
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(values))
+
+
+def aggregate_daily_counts(rows, sign=1):
+    """Regroupe une liste de mouvements par (jour, type de mouvement)"""
+    counts = defaultdict(int)
+    for row in rows:
+        get = row.get if isinstance(row, dict) else (lambda name: getattr(row, name, None))
+        counts[(_to_day(get('movement_date')), get('movement_type') or 'transfer')] += sign
+    return counts
+
+
+def _daily_upsert_statement(connection):
+    """INSERT ... ON CONFLICT/DUPLICATE KEY qui additionne les compteurs journaliers"""
+    table = StockMovementDailyCount.__table__
+    dialect = connection.dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table)
+        return stmt.on_duplicate_key_update(
+            movements_count=table.c.movements_count + stmt.inserted.movements_count,
+        )
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=list(_DAILY_KEY_COLUMNS),
+            set_={'movements_count': table.c.movements_count + stmt.excluded.movements_count},
+        )
+
+    return None
+
+
+def apply_daily_counts(connection, counts):
+    """Applique des deltas de compteurs journaliers (upsert additif)"""
+    table = StockMovementDailyCount.__table__
+    rows = [dict(zip(_DAILY_KEY_COLUMNS, key), movements_count=count)
+            for key, count in counts.items() if count]
+    if not rows:
+        return
+
+    stmt = _daily_upsert_statement(connection)
+    if stmt is not None:
+        connection.execute(stmt, rows)
+        return
+
+    for values in rows:
+        key_filter = and_(*[table.c[col] == values[col] for col in _DAILY_KEY_COLUMNS])
+        result = connection.execute(
+            table.update().where(key_filter).values(
+                movements_count=table.c.movements_count + values['movements_count'],
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(values))
+
+
+def apply_movement_rows(connection, rows, sign=1):
+    """
+    Répercute une liste de mouvements sur le grand livre et les compteurs journaliers
+    À utiliser pour les écritures en masse qui ne passent pas par l'ORM
+    (sign=-1 pour retirer des mouvements supprimés)
+    """
+    apply_deltas(connection, aggregate_contributions(rows, sign))
+    apply_daily_counts(connection, aggregate_daily_counts(rows, sign))
+
+
+# =========================================================
+# MAINTENANCE INCRÉMENTALE (listeners ORM)
+# =========================================================
+
+def _fetch_persisted_row(connection, movement_id):
+    """Relit en base les colonnes d'un mouvement avant sa modification/suppression"""
+    table = StockMovement.__table__
+    columns = [table.c[name] for name in LEDGER_FIELDS]
+    row = connection.execute(select(*columns).where(table.c.id == movement_id)).mappings().first()
+    return dict(row) if row else None
+
+
+def _ledger_fields_changed(target):
+    state = db.inspect(target)
+    return any(state.attrs[name].history.has_changes() for name in LEDGER_FIELDS)
+
+
+@event.listens_for(StockMovement, 'after_insert')
+def _ledger_after_insert(mapper, connection, target):
+    apply_movement_rows(connection, [target])
+
+
+@event.listens_for(StockMovement, 'before_update')
+def _ledger_before_update(mapper, connection, target):
+    if not _ledger_fields_changed(target):
+        return
+    previous = _fetch_persisted_row(connection, target.id)
+    if previous:
+        apply_movement_rows(connection, [previous], sign=-1)
+    target._ledger_needs_reapply = True
+
+
+@event.listens_for(StockMovement, 'after_update')
+def _ledger_after_update(mapper, connection, target):
+    if getattr(target, '_ledger_needs_reapply', False):
+        target._ledger_needs_reapply = False
+        apply_movement_rows(connection, [target])
+
+
+@event.listens_for(StockMovement, 'before_delete')
+def _ledger_before_delete(mapper, connection, target):
+    previous = _fetch_persisted_row(connection, target.id)
+    if previous:
+        apply_movement_rows(connection, [previous], sign=-1)
+
+
+# =========================================================
+# REQUÊTES AGRÉGÉES
+# =========================================================
+
+def _scope_condition(depot_ids=None, vehicle_ids=None):
+    """
+    Condition SQL sur les emplacements
+    None = tous les emplacements de ce type, [] = aucun
+    """
+    conditions = []
+    for location_type, ids in ((LOCATION_DEPOT, depot_ids), (LOCATION_VEHICLE, vehicle_ids)):
+        if ids is None:
+            conditions.append(StockBalanceLedger.location_type == location_type)
+        elif ids:
+            conditions.append(and_(
+                StockBalanceLedger.location_type == location_type,
+                StockBalanceLedger.location_id.in_(list(ids))
+            ))
+    return or_(*conditions) if conditions else false()
+
+
+def _item_condition(stock_item_ids):
+    if stock_item_ids is None:
+        return None
+    return StockBalanceLedger.stock_item_id.in_(list(stock_item_ids))
+
+
+def get_balances(depot_ids=None, vehicle_ids=None, stock_item_ids=None, before=None):
+    """
+    Soldes par (type d'emplacement, emplacement, article)
+
+    Args:
+        depot_ids / vehicle_ids: emplacements à inclure (None = tous, [] = aucun)
+        stock_item_ids: articles à inclure (None = tous)
+        before: si fourni, ne compte que les jours strictement antérieurs (stock initial)
+
+    Returns:
+        dict: (location_type, location_id, stock_item_id) -> Decimal
+    """
+    balance = func.sum(StockBalanceLedger.quantity_in - StockBalanceLedger.quantity_out)
+    query = db.session.query(
+        StockBalanceLedger.location_type,
+        StockBalanceLedger.location_id,
+        StockBalanceLedger.stock_item_id,
+        balance
+    ).filter(_scope_condition(depot_ids, vehicle_ids))
+
+    item_condition = _item_condition(stock_item_ids)
+    if item_condition is not None:
+        query = query.filter(item_condition)
+    if before is not None:
+        query = query.filter(StockBalanceLedger.day < _to_day(before))
+
+    query = query.group_by(
+        StockBalanceLedger.location_type,
+        StockBalanceLedger.location_id,
+        StockBalanceLedger.stock_item_id
+    )
+    return {
+        (location_type, location_id, item_id): _to_decimal(total)
+        for location_type, location_id, item_id, total in query.all()
+    }
+
+
+def get_flows(depot_ids=None, vehicle_ids=None, stock_item_ids=None, start=None, end=None, group_by='item'):
+    """
+    Entrées, sorties et nombre de mouvements sur une période (granularité journalière)
+
+    Args:
+        start: premier jour inclus (None = depuis le début)
+        end: premier jour exclu (None = sans limite)
+        group_by: 'item' -> clé stock_item_id
+                  'location_type' -> clé (location_type, location_id, movement_type)
+
+    Returns:
+        dict: clé -> {'in': Decimal, 'out': Decimal, 'count': int}
+    """
+    if group_by == 'item':
+        key_columns = [StockBalanceLedger.stock_item_id]
+    elif group_by == 'location_type':
+        key_columns = [
+            StockBalanceLedger.location_type,
+            StockBalanceLedger.location_id,
+            StockBalanceLedger.movement_type,
+        ]
+    else:
+        raise ValueError(f"group_by inconnu: {group_by}")
+
+    query = db.session.query(
+        *key_columns,
+        func.sum(StockBalanceLedger.quantity_in),
+        func.sum(StockBalanceLedger.quantity_out),
+        func.sum(StockBalanceLedger.movements_count)
+    ).filter(_scope_condition(depot_ids, vehicle_ids))
+
+    item_condition = _item_condition(stock_item_ids)
+    if item_condition is not None:
+        query = query.filter(item_condition)
+    if start is not None:
+        query = query.filter(StockBalanceLedger.day >= _to_day(start))
+    if end is not None:
+        query = query.filter(StockBalanceLedger.day < _to_day(end))
+
+    flows = {}
+    for row in query.group_by(*key_columns).all():
+        key = row[0] if len(key_columns) == 1 else tuple(row[:len(key_columns)])
+        qty_in, qty_out, count = row[len(key_columns):]
+        flows[key] = {
+            'in': _to_decimal(qty_in),
+            'out': _to_decimal(qty_out),
+            'count': int(count or 0),
+        }
+    return flows
+
+
+# =========================================================
+# RECONSTRUCTION / VÉRIFICATION
+# =========================================================
+
+def replay_movements(batch_size=5000):
+    """Rejoue intégralement stock_movements et retourne les totaux attendus du grand livre"""
+    columns = [getattr(StockMovement, name) for name in LEDGER_FIELDS]
+    query = db.session.query(*columns).order_by(StockMovement.id).yield_per(batch_size)
+    rows = (dict(zip(LEDGER_FIELDS, row)) for row in query)
+    return aggregate_contributions(rows)
+
+
+def _ledger_contents():
+    table = StockBalanceLedger.__table__
+    result = {}
+    for row in db.session.execute(select(table)).mappings():
+        key = tuple(row[col] if col != 'day' else _to_day(row[col]) for col in _KEY_COLUMNS)
+        result[key] = [_to_decimal(row['quantity_in']), _to_decimal(row['quantity_out']), int(row['movements_count'])]
+    return result
+
+
+def verify_ledger(batch_size=5000):
+    """
+    Compare le grand livre avec un rejeu complet des mouvements
+
+    Returns:
+        dict: {'ok': bool, 'checked': int, 'mismatches': [ {key, expected, actual} ]}
+    """
+    expected = {key: values for key, values in replay_movements(batch_size).items()
+                if any(values)}
+    actual = {key: values for key, values in _ledger_contents().items()
+              if any(values)}
+
+    mismatches = []
+    for key in set(expected) | set(actual):
+        exp = expected.get(key, [Decimal('0'), Decimal('0'), 0])
+        act = actual.get(key, [Decimal('0'), Decimal('0'), 0])
+        if exp[0] != act[0] or exp[1] != act[1] or exp[2] != act[2]:
+            mismatches.append({
+                'key': dict(zip(_KEY_COLUMNS, key)),
+                'expected': {'in': exp[0], 'out': exp[1], 'count': exp[2]},
+                'actual': {'in': act[0], 'out': act[1], 'count': act[2]},
+            })
+
+    # Compteurs journaliers
+    expected_counts = defaultdict(int)
+    rows = db.session.query(StockMovement.movement_date, StockMovement.movement_type).yield_per(batch_size)
+    for movement_date, movement_type in rows:
+        expected_counts[(_to_day(movement_date), movement_type)] += 1
+    actual_counts = {
+        (_to_day(row_day), movement_type): count
+        for row_day, movement_type, count in db.session.execute(select(StockMovementDailyCount.__table__))
+        if count
+    }
+    for key in set(expected_counts) | set(actual_counts):
+        if expected_counts.get(key, 0) != actual_counts.get(key, 0):
+            mismatches.append({
+                'key': dict(zip(_DAILY_KEY_COLUMNS, key)),
+                'expected': {'count': expected_counts.get(key, 0)},
+                'actual': {'count': actual_counts.get(key, 0)},
+            })
+    return {'ok': not mismatches, 'checked': len(expected) + len(expected_counts), 'mismatches': mismatches}
+
+
+def rebuild_ledger(batch_size=5000, insert_chunk=1000):
+    """
+    Reconstruit entièrement le grand livre depuis stock_movements
+
+    Returns:
+        int: nombre de lignes écrites dans le grand livre
+    """
+    totals = replay_movements(batch_size)
+    table = StockBalanceLedger.__table__
+
+    db.session.execute(table.delete())
+    rows = []
+    for key, (qty_in, qty_out, count) in totals.items():
+        if qty_in == 0 and qty_out == 0 and count == 0:
+            continue
+        values = dict(zip(_KEY_COLUMNS, key))
+        values.update(quantity_in=qty_in, quantity_out=qty_out, movements_count=count)
+        rows.append(values)
+
+    for i in range(0, len(rows), insert_chunk):
+        db.session.execute(table.insert(), rows[i:i + insert_chunk])
+    rebuild_daily_counts(commit=False)
+    db.session.commit()
+    return len(rows)
+
+
+def rebuild_daily_counts(commit=True):
+    """
+    Reconstruit les compteurs journaliers par une requête groupée sur stock_movements
+
+    Returns:
+        int: nombre de lignes (jour, type) écrites
+    """
+    from analytics_series import date_trunc, _as_date
+
+    day = date_trunc(StockMovement.movement_date, 'day')
+    grouped = db.session.execute(
+        select(day, StockMovement.movement_type, func.count(StockMovement.id))
+        .group_by(day, StockMovement.movement_type)
+    ).all()
+    table = StockMovementDailyCount.__table__
+    db.session.execute(table.delete())
+    rows = [{'day': _as_date(row_day), 'movement_type': movement_type, 'movements_count': count}
+            for row_day, movement_type, count in grouped]
+    if rows:
+        db.session.execute(table.insert(), rows)
+    if commit:
+        db.session.commit()
+    return len(rows)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mutations atomiques des stocks de dépôts et de véhicules
+
+Toutes les variations de DepotStock / VehicleStock passent par ce module au
+lieu de lectures-modifications-écritures Python (`stock.quantity -= q`) qui
+perdent des mises à jour sous accès concurrents :
+- chaque variation est un UPDATE ... SET quantity = quantity + :delta, avec la
+  condition « quantity + :delta >= 0 » dans la même instruction pour refuser
+  un stock négatif ;
+- les lignes sont touchées dans un ordre déterministe (type d'emplacement,
+  emplacement, article) : deux lots concurrents ne peuvent pas s'interbloquer ;
+- les lignes de stock absentes sont créées à 0 avant la variation ;
+- record_movements() dérive les variations des mouvements (même règle que le
+  grand livre stock_ledger), les applique puis insère les StockMovement par
+  insertion groupée, en répercutant le grand livre, les bons de mouvement
+  (movement_batches), l'index de recherche et l'invalidation au commit des
+  statistiques du tableau de bord et des KPIs de stock.
+
+Le tout s'exécute dans la transaction de db.session : l'appelant valide
+(commit) ou annule (rollback) l'ensemble.
+"""
+
+from collections import defaultdict
+from datetime import datetime, UTC
+from decimal import Decimal
+
+from sqlalchemy import bindparam, insert, select, tuple_, update
+
+from models import db, DepotStock, VehicleStock, StockMovement
+from stock_ledger import (
+    LOCATION_DEPOT, LOCATION_VEHICLE, LEDGER_FIELDS, movement_contributions, apply_movement_rows
+)
+import search_indexer
+import movement_batches
+import dashboard_stats
+import analytics
+
+_STOCK_MODELS = {
+    LOCATION_DEPOT: (DepotStock, 'depot_id'),
+    LOCATION_VEHICLE: (VehicleStock, 'vehicle_id'),
+}
+
+# Colonnes écrites pour chaque mouvement inséré (les absentes valent None)
+_MOVEMENT_COLUMNS = [column.name for column in StockMovement.__table__.columns if column.name != 'id']
+
+
+class InsufficientStockError(ValueError):
+    """Variation refusée : le stock deviendrait négatif"""
+
+    def __init__(self, shortages):
+        # shortages : liste de dicts {location_type, location_id, stock_item_id, available, requested}
+        self.shortages = shortages
+        super().__init__("; ".join(
+            f"Stock insuffisant ({shortage['location_type']} {shortage['location_id']}, "
+            f"article {shortage['stock_item_id']} : disponible {shortage['available']}, "
+            f"requis {shortage['requested']})"
+            for shortage in shortages
+        ))
+
+
+def depot_delta(depot_id, stock_item_id, delta):
+    return (LOCATION_DEPOT, int(depot_id), int(stock_item_id), Decimal(str(delta)))
+
+
+def vehicle_delta(vehicle_id, stock_item_id, delta):
+    return (LOCATION_VEHICLE, int(vehicle_id), int(stock_item_id), Decimal(str(delta)))
+
+
+def movement_deltas(rows):
+    """Variations de stock induites par des mouvements (règle du grand livre)"""
+    deltas = []
+    for row in rows:
+        for key, qty_in, qty_out in movement_contributions(row):
+            location_type, location_id, stock_item_id = key[:3]
+            deltas.append((location_type, location_id, stock_item_id, qty_in - qty_out))
+    return deltas
+
+
+def movement_change_deltas(movement, new_quantity):
+    """Variations de stock quand la quantité signée d'un mouvement existant change"""
+    before = {name: getattr(movement, name) for name in LEDGER_FIELDS}
+    after = dict(before, quantity=new_quantity)
+    return movement_deltas([after]) + [
+        (location_type, location_id, stock_item_id, -delta)
+        for location_type, location_id, stock_item_id, delta in movement_deltas([before])
+    ]
+
+
+def apply_stock_deltas(deltas, allow_negative=False):
+    """
+    Applique un lot de variations de stock de façon atomique
+
+    Args:
+        deltas: itérable de (location_type, location_id, stock_item_id, delta)
+        allow_negative: accepter un solde négatif (ajustements, inventaires) ;
+            les lignes sont alors mises à jour en une instruction groupée
+
+    Returns:
+        dict: (location_type, location_id, stock_item_id) -> variation totale appliquée
+
+    Raises:
+        InsufficientStockError: une ou plusieurs lignes deviendraient négatives
+            (rien n'est annulé ici : l'appelant fait le rollback)
+    """
+    totals = defaultdict(Decimal)
+    for location_type, location_id, stock_item_id, delta in deltas:
+        totals[(location_type, int(location_id), int(stock_item_id))] += Decimal(str(delta))
+    keys = sorted(key for key, delta in totals.items() if delta != 0)
+    if not keys:
+        return {}
+
+    db.session.flush()
+    _ensure_rows([key for key in keys if allow_negative or totals[key] > 0])
+
+    _mark_caches_dirty()
+    now = datetime.now(UTC)
+    if allow_negative:
+        # Pas de condition par ligne (toutes créées ci-dessus) : une instruction groupée par type
+        _update_grouped(keys, totals, now)
+        _expire_cached(keys)
+        return {key: totals[key] for key in keys}
+
+    short_keys = []
+    for key in keys:
+        location_type, location_id, stock_item_id = key
+        model, location_column = _STOCK_MODELS[location_type]
+        table = model.__table__
+        delta = totals[key]
+        statement = (
+            update(table)
+            .where(table.c[location_column] == location_id, table.c.stock_item_id == stock_item_id)
+            .values(quantity=table.c.quantity + delta, updated_at=now)
+        )
+        if delta < 0 and not allow_negative:
+            statement = statement.where(table.c.quantity + delta >= 0)
+        if db.session.execute(statement).rowcount == 0:
+            short_keys.append(key)
+
+    _expire_cached(keys)
+    if short_keys:
+        available = get_levels(short_keys)
+        raise InsufficientStockError([
+            {'location_type': key[0], 'location_id': key[1], 'stock_item_id': key[2],
+             'available': available[key], 'requested': -totals[key]}
+            for key in short_keys
+        ])
+    return {key: totals[key] for key in keys}
+
+
+def get_levels(keys, lock=False):
+    """
+    Quantités actuelles d'une liste de clés (0 si la ligne n'existe pas)
+
+    Args:
+        keys: (location_type, location_id, stock_item_id)
+        lock: verrouiller les lignes (FOR UPDATE) dans l'ordre des clés, par
+              exemple pour fixer un niveau de stock (ajustement, inventaire)
+    """
+    levels = {key: Decimal('0') for key in keys}
+    by_type = defaultdict(list)
+    for location_type, location_id, stock_item_id in sorted(levels):
+        by_type[location_type].append((location_id, stock_item_id))
+    for location_type in sorted(by_type):
+        model, location_column = _STOCK_MODELS[location_type]
+        table = model.__table__
+        statement = (
+            select(table.c[location_column], table.c.stock_item_id, table.c.quantity)
+            .where(_pairs_condition(table, location_column, by_type[location_type]))
+            .order_by(table.c[location_column], table.c.stock_item_id)
+        )
+        if lock:
+            statement = statement.with_for_update()
+        for location_id, stock_item_id, quantity in db.session.execute(statement):
+            levels[(location_type, location_id, stock_item_id)] = Decimal(str(quantity or 0))
+    return levels
+
+
+def record_movements(rows, allow_negative=False):
+    """
+    Applique les variations de stock d'une liste de mouvements puis les insère
+
+    Args:
+        rows: dicts de colonnes StockMovement (mouvements à sens unique : from_*
+              ou to_* ; un transfert s'écrit en deux lignes SORTIE / ENTRÉE)
+        allow_negative: voir apply_stock_deltas
+
+    Returns:
+        list: identifiants des mouvements insérés (ordre non garanti : ils ne
+              servent qu'à l'indexation, et l'exiger forcerait une insertion
+              ligne à ligne sur certains moteurs)
+    """
+    if not rows:
+        return []
+    now = datetime.now(UTC)
+    rows = [_movement_row(row, now) for row in rows]
+    apply_stock_deltas(movement_deltas(rows), allow_negative=allow_negative)
+    # Lignes rattachées à leur bon (référence de base) avant insertion
+    movement_batches.assign_batches(db.session.connection(), rows)
+
+    table = StockMovement.__table__
+    if db.session.connection().dialect.insert_executemany_returning:
+        movement_ids = list(db.session.execute(
+            insert(table).returning(table.c.id), rows
+        ).scalars())
+    else:
+        # MySQL : pas de RETURNING, insertion ligne à ligne pour récupérer les identifiants
+        movement_ids = [db.session.execute(insert(table), row).inserted_primary_key[0] for row in rows]
+
+    # Écritures hors ORM : grand livre et index de recherche répercutés explicitement
+    apply_movement_rows(db.session.connection(), rows)
+    movement_batches.refresh_batches(db.session.connection(), [row['batch_id'] for row in rows])
+    search_indexer.mark_for_indexing(db.session, 'stock_movement', movement_ids)
+    _mark_caches_dirty()
+    return movement_ids
+
+
+def _mark_caches_dirty():
+    """
+    Les écritures groupées ne passent pas par le flush ORM : les caches invalidés
+    au commit (statistiques du tableau de bord, KPIs de stock) sont prévenus ici
+    """
+    dashboard_stats.mark_dirty(db.session)
+    analytics.mark_stock_kpis_dirty(db.session)
+
+
+def _movement_row(row, now):
+    values = {column: row.get(column) for column in _MOVEMENT_COLUMNS}
+    values['movement_date'] = values['movement_date'] or now
+    values['created_at'] = values['created_at'] or now
+    return values
+
+
+def _update_grouped(keys, totals, now):
+    """UPDATE quantity = quantity + delta exécuté en executemany (une instruction par type d'emplacement)"""
+    by_type = defaultdict(list)
+    for location_type, location_id, stock_item_id in keys:
+        by_type[location_type].append({
+            'b_location_id': location_id, 'b_stock_item_id': stock_item_id,
+            'b_delta': totals[(location_type, location_id, stock_item_id)]
+        })
+    for location_type in sorted(by_type):
+        model, location_column = _STOCK_MODELS[location_type]
+        table = model.__table__
+        db.session.execute(
+            update(table)
+            .where(table.c[location_column] == bindparam('b_location_id'),
+                   table.c.stock_item_id == bindparam('b_stock_item_id'))
+            .values(quantity=table.c.quantity + bindparam('b_delta', type_=table.c.quantity.type), updated_at=now),
+            by_type[location_type]
+        )
+
+
+def _pairs_condition(table, location_column, pairs):
+    return tuple_(table.c[location_column], table.c.stock_item_id).in_(pairs)
+
+
+def _ensure_rows(keys):
+    """Crée à 0 les lignes de stock absentes (insertion groupée, sans conflit)"""
+    if not keys:
+        return
+    existing = set(_existing_keys(keys))
+    now = datetime.now(UTC)
+    by_type = defaultdict(list)
+    for key in keys:
+        if key not in existing:
+            location_type, location_id, stock_item_id = key
+            by_type[location_type].append({
+                _STOCK_MODELS[location_type][1]: location_id, 'stock_item_id': stock_item_id,
+                'quantity': Decimal('0'), 'updated_at': now
+            })
+    for location_type in sorted(by_type):
+        table = _STOCK_MODELS[location_type][0].__table__
+        db.session.execute(_insert_ignore(table), by_type[location_type])
+
+
+def _existing_keys(keys):
+    """Clés dont la ligne de stock existe"""
+    found = []
+    by_type = defaultdict(list)
+    for location_type, location_id, stock_item_id in keys:
+        by_type[location_type].append((location_id, stock_item_id))
+    for location_type, pairs in by_type.items():
+        model, location_column = _STOCK_MODELS[location_type]
+        table = model.__table__
+        for location_id, stock_item_id in db.session.execute(
+            select(table.c[location_column], table.c.stock_item_id)
+            .where(_pairs_condition(table, location_column, pairs))
+        ):
+            found.append((location_type, location_id, stock_item_id))
+    return found
+
+
+def _insert_ignore(table):
+    """INSERT qui ignore les lignes créées entre-temps par une autre transaction"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        return dialect_insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        return dialect_insert(table).on_conflict_do_nothing()
+    if dialect == 'mysql':
+        return insert(table).prefix_with('IGNORE')
+    return insert(table)
+
+
+def _expire_cached(keys):
+    """Invalide les DepotStock/VehicleStock chargés en session dont la quantité a changé"""
+    wanted = set(keys)
+    for instance in list(db.session.identity_map.values()):
+        if isinstance(instance, DepotStock):
+            key = (LOCATION_DEPOT, instance.depot_id, instance.stock_item_id)
+        elif isinstance(instance, VehicleStock):
+            key = (LOCATION_VEHICLE, instance.vehicle_id, instance.stock_item_id)
+        else:
+            continue
+        if key in wanted:
+            db.session.expire(instance, ['quantity', 'updated_at'])
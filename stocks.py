@@ -12,14 +12,22 @@ from decimal import Decimal, InvalidOperation
 from io import BytesIO
 import time
 from models import (
-    db, DepotStock, VehicleStock, StockMovement, StockItem, 
+    db, DepotStock, VehicleStock, StockMovement, StockMovementBatch, StockItem, 
     Depot, Vehicle, Reception, ReceptionDetail, User,
     StockOutgoing, StockOutgoingDetail, StockReturn, StockReturnDetail,
     StockLoadingSummary, StockLoadingSummaryItem, CommercialOrder, CommercialOrderClient, Role
 )
 from auth import has_permission
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy import or_, and_
+import stock_ledger  # Enregistre aussi les listeners de maintenance du grand livre
+import schema_registry
+import reference_sequences
+import stock_mutations
+import job_queue
+import export_engine
+import movement_listing
+import movement_batches
 
 # Créer le blueprint
 stocks_bp = Blueprint('stocks', __name__, url_prefix='/stocks')
@@ -168,77 +176,35 @@ def can_create_returns(user):
     
     return has_permission(user, 'returns.create')
 
-def extract_base_reference(reference):
+MOVEMENT_REFERENCE_PREFIXES = {
+    'transfer': 'TRANS',
+    'reception': 'REC',
+    'reception_return': 'RET-REC',  # Retour fournisseur (mouvement inverse de réception)
+    'adjustment': 'AJUST',
+    'inventory': 'INV'
+}
+
+def generate_movement_reference(movement_type='transfer', existing_references=None):
     """
-    Extrait la référence de base d'un mouvement (sans -OUT, -IN, etc.)
-    Exemples:
-    - TRANS-20250110-1-OUT -> TRANS-20250110-1
-    - TRANS-20250110-1-IN -> TRANS-20250110-1
-    - TRANS-20250110-1-OUT-2 -> TRANS-20250110-1
-    - REC-20250110-1 -> REC-20250110-1
+    Génère une référence unique pour un mouvement de stock (compteur du jour,
+    voir reference_sequences). `existing_references` est conservé pour
+    compatibilité : chaque appel réserve un numéro distinct.
     """
-    if not reference:
-        return None
-    
-    # Enlever les suffixes -OUT, -IN et leurs variantes numérotées
-    import re
-    # Pattern pour enlever -OUT, -IN, -OUT-1, -IN-2, etc.
-    base_ref = re.sub(r'-(OUT|IN)(-\d+)?$', '', reference)
-    return base_ref
+    return reference_sequences.next_reference(MOVEMENT_REFERENCE_PREFIXES.get(movement_type, 'MV'))
 
-def generate_movement_reference(movement_type='transfer', existing_references=None):
-    """Génère une référence unique pour un mouvement de stock"""
-    from datetime import datetime, UTC
-    prefix_map = {
-        'transfer': 'TRANS',
-        'reception': 'REC',
-        'reception_return': 'RET-REC',  # Retour fournisseur (mouvement inverse de réception)
-        'adjustment': 'AJUST',
-        'inventory': 'INV'
-    }
-    prefix = prefix_map.get(movement_type, 'MV')
-    date_str = datetime.now().strftime('%Y%m%d')
-    
-    # Chercher le dernier mouvement du jour avec ce préfixe
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    last_movement = StockMovement.query.filter(
-        StockMovement.reference.like(f'{prefix}-{date_str}-%'),
-        StockMovement.created_at >= today_start
-    ).order_by(StockMovement.id.desc()).first()
-    
-    # Déterminer le numéro de départ
-    if last_movement and last_movement.reference:
-        # Extraire la référence de base pour obtenir le numéro séquentiel
-        base_ref = extract_base_reference(last_movement.reference)
-        try:
-            # Extraire le numéro séquentiel de la référence de base
-            parts = base_ref.split('-')
-            if len(parts) >= 3:
-                last_num = int(parts[-1])
-                next_num = last_num + 1
-            else:
-                next_num = 1
-        except (ValueError, IndexError):
-            next_num = 1
-    else:
-        next_num = 1
-    
-    # Si des références existent déjà dans cette transaction, trouver le prochain numéro disponible
-    if existing_references:
-        used_nums = set()
-        for ref in existing_references:
-            if ref and ref.startswith(f'{prefix}-{date_str}-'):
-                try:
-                    num = int(ref.split('-')[-1])
-                    used_nums.add(num)
-                except (ValueError, IndexError):
-                    pass
-        
-        # Trouver le premier numéro non utilisé
-        while next_num in used_nums:
-            next_num += 1
-    
-    return f"{prefix}-{date_str}-{next_num:04d}"
+def _format_quantity(value):
+    """Quantité sans décimales inutiles (affichage)"""
+    return f"{Decimal(str(value)):.4f}".rstrip('0').rstrip('.')
+
+def insufficient_stock_messages(error, label="Stock insuffisant pour"):
+    """Messages utilisateur d'une InsufficientStockError (noms d'articles chargés en une requête)"""
+    item_ids = {shortage['stock_item_id'] for shortage in error.shortages}
+    names = dict(db.session.query(StockItem.id, StockItem.name).filter(StockItem.id.in_(item_ids)).all())
+    return [
+        f"{label} {names.get(shortage['stock_item_id'], 'ID ' + str(shortage['stock_item_id']))} "
+        f"(disponible: {_format_quantity(shortage['available'])}, requis: {_format_quantity(shortage['requested'])})"
+        for shortage in error.shortages
+    ]
 
 def get_movement_form_data():
     """Helper pour récupérer les données du formulaire de mouvement (filtrées par région)"""
@@ -393,33 +359,27 @@ def vehicle_low_stock(vehicle_id):
 # MOUVEMENTS DE STOCK
 # =========================================================
 
-@stocks_bp.route('/movements')
-@login_required
-def movements_list():
-    """Liste des mouvements de stock avec pagination et filtres"""
-    if not can_access_movements(current_user):
-        flash('Vous n\'avez pas la permission d\'accéder à cette page', 'error')
-        return redirect(url_for('index'))
-    
-    from sqlalchemy import or_, and_, func
-    from datetime import datetime, timedelta
+def _movements_list_query(args):
+    """
+    Requête filtrée de la liste des mouvements (région de l'utilisateur puis filtres de l'URL)
+
+    Returns:
+        tuple: (query, filtres actifs) - la requête n'a pas d'ORDER BY (pagination par curseur)
+    """
     from utils_region_filter import filter_stock_movements_by_region
     
-    # Paramètres de pagination
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 50, type=int)
-    
-    # Filtres
-    movement_type = request.args.get('type', '')
-    search = request.args.get('search', '').strip()
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    stock_item_id = request.args.get('stock_item_id', type=int)
-    depot_id = request.args.get('depot_id', type=int)
-    vehicle_id = request.args.get('vehicle_id', type=int)
-    user_id = request.args.get('user_id', type=int)
-    items_count = request.args.get('items_count', type=int)  # Nombre d'articles dans un transfert
-    base_reference = request.args.get('base_reference', '').strip()  # Recherche par référence de base
+    filters = {
+        'type': args.get('type', ''),
+        'search': args.get('search', '').strip(),
+        'date_from': args.get('date_from', ''),
+        'date_to': args.get('date_to', ''),
+        'stock_item_id': args.get('stock_item_id', type=int),
+        'depot_id': args.get('depot_id', type=int),
+        'vehicle_id': args.get('vehicle_id', type=int),
+        'user_id': args.get('user_id', type=int),
+        'base_reference': args.get('base_reference', '').strip(),  # Recherche par référence de base
+        'items_count': args.get('items_count', type=int),  # Nombre d'articles dans un transfert
+    }
     
     # Construire la requête avec optimisation N+1
     query = StockMovement.query.options(
@@ -428,19 +388,19 @@ def movements_list():
         joinedload(StockMovement.to_depot),
         joinedload(StockMovement.from_vehicle),
         joinedload(StockMovement.to_vehicle),
-        joinedload(StockMovement.user)
+        joinedload(StockMovement.user),
+        joinedload(StockMovement.batch)
     )
     
     # Filtrer par région de l'utilisateur AVANT d'appliquer les autres filtres
     query = filter_stock_movements_by_region(query)
     
     # Appliquer les filtres
-    if movement_type:
-        query = query.filter(StockMovement.movement_type == movement_type)
+    if filters['type']:
+        query = query.filter(StockMovement.movement_type == filters['type'])
     
-    if search:
-        search_pattern = f'%{search}%'
-        # Joindre StockItem uniquement pour la recherche si nécessaire
+    if filters['search']:
+        search_pattern = f"%{filters['search']}%"
         # Utiliser outerjoin pour ne pas exclure les mouvements sans article
         query = query.outerjoin(StockItem, StockMovement.stock_item_id == StockItem.id)
         query = query.filter(
@@ -453,277 +413,224 @@ def movements_list():
             )
         )
     
-    if date_from:
+    if filters['date_from']:
         try:
-            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
+            date_from_obj = datetime.strptime(filters['date_from'], '%Y-%m-%d')
             query = query.filter(StockMovement.movement_date >= date_from_obj)
         except ValueError:
             pass
     
-    if date_to:
+    if filters['date_to']:
         try:
-            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+            date_to_obj = datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1)
             query = query.filter(StockMovement.movement_date < date_to_obj)
         except ValueError:
             pass
     
-    if stock_item_id:
-        query = query.filter(StockMovement.stock_item_id == stock_item_id)
+    if filters['stock_item_id']:
+        query = query.filter(StockMovement.stock_item_id == filters['stock_item_id'])
     
-    if depot_id:
+    if filters['depot_id']:
         query = query.filter(
             or_(
-                StockMovement.from_depot_id == depot_id,
-                StockMovement.to_depot_id == depot_id
+                StockMovement.from_depot_id == filters['depot_id'],
+                StockMovement.to_depot_id == filters['depot_id']
             )
         )
     
-    if vehicle_id:
+    if filters['vehicle_id']:
         query = query.filter(
             or_(
-                StockMovement.from_vehicle_id == vehicle_id,
-                StockMovement.to_vehicle_id == vehicle_id
+                StockMovement.from_vehicle_id == filters['vehicle_id'],
+                StockMovement.to_vehicle_id == filters['vehicle_id']
             )
         )
     
-    if user_id:
-        query = query.filter(StockMovement.user_id == user_id)
+    if filters['user_id']:
+        query = query.filter(StockMovement.user_id == filters['user_id'])
     
-    # Recherche par référence de base (pour regrouper les transferts)
-    if base_reference:
-        # Rechercher toutes les références qui commencent par la référence de base
-        query = query.filter(
-            or_(
-                StockMovement.reference.like(f'{base_reference}%'),
-                StockMovement.reference.like(f'{base_reference}-OUT%'),
-                StockMovement.reference.like(f'{base_reference}-IN%')
-            )
-        )
+    # Référence de bon et nombre d'articles : colonnes indexées de l'en-tête du bon
+    if filters['base_reference'] or filters['items_count']:
+        query = query.join(StockMovementBatch, StockMovement.batch_id == StockMovementBatch.id)
+        if filters['base_reference']:
+            query = query.filter(StockMovementBatch.reference.like(f"{filters['base_reference']}%"))
+        if filters['items_count']:
+            query = query.filter(StockMovementBatch.items_count == filters['items_count'])
     
-    # Recherche par nombre d'articles dans un transfert
-    # Note: Cette recherche est complexe car elle nécessite de grouper par référence de base
-    # Pour l'instant, on va filtrer après la requête principale pour simplifier
-    # (optimisation possible avec une sous-requête SQL si nécessaire)
+    return query, filters
+
+def _movements_per_page(args):
+    """Taille de page demandée, bornée à 1..200"""
+    return min(max(args.get('per_page', 50, type=int), 1), 200)
+
+@stocks_bp.route('/movements')
+@login_required
+def movements_list():
+    """Liste des mouvements de stock avec pagination par curseur et filtres"""
+    if not can_access_movements(current_user):
+        flash('Vous n\'avez pas la permission d\'accéder à cette page', 'error')
+        return redirect(url_for('index'))
     
-    # Pagination
-    pagination = query.order_by(StockMovement.movement_date.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    movements = pagination.items
+    from utils_region_filter import get_region_scope
     
-    # Grouper les mouvements par référence de base pour l'affichage
-    movements_by_base_ref = {}
-    for movement in movements:
-        base_ref = extract_base_reference(movement.reference) if movement.reference else None
-        if base_ref:
-            if base_ref not in movements_by_base_ref:
-                movements_by_base_ref[base_ref] = {
-                    'base_reference': base_ref,
-                    'movements': [],
-                    'items_count': 0,
-                    'unique_items': set(),
-                    'from_depot': None,
-                    'to_depot': None,
-                    'from_vehicle': None,
-                    'to_vehicle': None,
-                    'movement_date': None,
-                    'user': None
-                }
-            movements_by_base_ref[base_ref]['movements'].append(movement)
-            movements_by_base_ref[base_ref]['unique_items'].add(movement.stock_item_id)
-            # Récupérer les infos communes du premier mouvement
-            if not movements_by_base_ref[base_ref]['from_depot']:
-                movements_by_base_ref[base_ref]['from_depot'] = movement.from_depot
-                movements_by_base_ref[base_ref]['to_depot'] = movement.to_depot
-                movements_by_base_ref[base_ref]['from_vehicle'] = movement.from_vehicle
-                movements_by_base_ref[base_ref]['to_vehicle'] = movement.to_vehicle
-                movements_by_base_ref[base_ref]['movement_date'] = movement.movement_date
-                movements_by_base_ref[base_ref]['user'] = movement.user
-    
-    # Calculer le nombre d'articles uniques pour chaque groupe
-    for base_ref in movements_by_base_ref:
-        movements_by_base_ref[base_ref]['items_count'] = len(movements_by_base_ref[base_ref]['unique_items'])
-    
-    # Filtrer par nombre d'articles si demandé
-    if items_count:
-        filtered_base_refs = {
-            base_ref: data for base_ref, data in movements_by_base_ref.items()
-            if data['items_count'] == items_count
-        }
-        # Filtrer les mouvements pour ne garder que ceux des références de base correspondantes
-        movements = [m for m in movements if extract_base_reference(m.reference) in filtered_base_refs]
-        movements_by_base_ref = filtered_base_refs
+    per_page = _movements_per_page(request.args)
     
-    # Statistiques globales
-    total_movements = StockMovement.query.count()
-    movements_by_type = {}
-    for mtype in ['transfer', 'reception', 'adjustment', 'inventory']:
-        movements_by_type[mtype] = StockMovement.query.filter_by(movement_type=mtype).count()
+    query, filters = _movements_list_query(request.args)
+    scope = get_region_scope()
     
-    # Statistiques pour graphiques (30 derniers jours) - Limité à 1000 pour performance
-    from datetime import datetime, timedelta
-    from utils_region_filter import filter_stock_movements_by_region
-    thirty_days_ago = datetime.now() - timedelta(days=30)
-    recent_movements_query = StockMovement.query.filter(
-        StockMovement.movement_date >= thirty_days_ago
-    )
-    # Filtrer par région
-    recent_movements_query = filter_stock_movements_by_region(recent_movements_query)
-    # Limiter à 1000 mouvements pour éviter de charger trop de données en mémoire
-    recent_movements = recent_movements_query.order_by(StockMovement.movement_date.desc()).limit(1000).all()
-    
-    # Préparer les données pour le graphique de tendance
-    movements_by_date = {}
-    for movement in recent_movements:
-        date_key = movement.movement_date.strftime('%Y-%m-%d') if movement.movement_date else ''
-        if date_key:
-            if date_key not in movements_by_date:
-                movements_by_date[date_key] = {'transfer': 0, 'reception': 0, 'adjustment': 0, 'inventory': 0, 'total': 0}
-            movements_by_date[date_key][movement.movement_type] = movements_by_date[date_key].get(movement.movement_type, 0) + 1
-            movements_by_date[date_key]['total'] += 1
-    
-    # Trier par date
-    sorted_dates = sorted(movements_by_date.keys())
-    chart_labels = sorted_dates
-    chart_transfer = [movements_by_date[d].get('transfer', 0) for d in sorted_dates]
-    chart_reception = [movements_by_date[d].get('reception', 0) for d in sorted_dates]
-    chart_adjustment = [movements_by_date[d].get('adjustment', 0) for d in sorted_dates]
-    chart_inventory = [movements_by_date[d].get('inventory', 0) for d in sorted_dates]
-    chart_total = [movements_by_date[d].get('total', 0) for d in sorted_dates]
+    # Pagination par curseur (movement_date, id) : pas d'OFFSET ni de COUNT(*) exact ;
+    # le filtre par nombre d'articles est appliqué en SQL, les pages restent pleines
+    pagination = movement_listing.keyset_page(query, after=request.args.get('after'),
+                                              before=request.args.get('before'), per_page=per_page)
+    movements = pagination.items
+    total_count, total_capped = movement_listing.approximate_count(query, scope, filters)
     
-    # Récupérer les données pour les filtres (filtrées par région)
-    from utils_region_filter import filter_depots_by_region, filter_vehicles_by_region
-    stock_items = StockItem.query.filter_by(is_active=True).order_by(StockItem.name).all()
-    depots_query = Depot.query.filter_by(is_active=True)
-    depots_query = filter_depots_by_region(depots_query)
-    depots = depots_query.order_by(Depot.name).all()
-    vehicles_query = Vehicle.query.filter_by(status='active')
-    vehicles_query = filter_vehicles_by_region(vehicles_query)
-    vehicles = vehicles_query.order_by(Vehicle.plate_number).all()
-    users = User.query.order_by(User.username).all()
+    # Compteurs par type et tendance 30 jours (table journalière ou requête groupée en cache, par région)
+    facets = movement_listing.movement_facets(scope)
     
-    # Préparer un dictionnaire pour faciliter l'accès aux données groupées dans le template
-    # Ajouter la référence de base à chaque mouvement pour faciliter l'affichage
-    for movement in movements:
-        if movement.reference:
-            movement.base_reference = extract_base_reference(movement.reference)
-        else:
-            movement.base_reference = None
+    # Listes des filtres (mises en cache par région)
+    options = movement_listing.filter_options(scope)
     
     return render_template('stocks/movements_list.html', 
                          movements=movements,
-                         movements_by_base_ref=movements_by_base_ref,
                          pagination=pagination,
-                         movement_type=movement_type,
-                         search=search,
-                         date_from=date_from,
-                         date_to=date_to,
-                         stock_item_id=stock_item_id,
-                         depot_id=depot_id,
-                         vehicle_id=vehicle_id,
-                         user_id=user_id,
-                         items_count=items_count,
-                         base_reference=base_reference,
+                         total_count=total_count,
+                         total_capped=total_capped,
+                         movement_type=filters['type'],
+                         search=filters['search'],
+                         date_from=filters['date_from'],
+                         date_to=filters['date_to'],
+                         stock_item_id=filters['stock_item_id'],
+                         depot_id=filters['depot_id'],
+                         vehicle_id=filters['vehicle_id'],
+                         user_id=filters['user_id'],
+                         items_count=filters['items_count'],
+                         base_reference=filters['base_reference'],
                          per_page=per_page,
-                         total_movements=total_movements,
-                         movements_by_type=movements_by_type,
-                         stock_items=stock_items,
-                         depots=depots,
-                         vehicles=vehicles,
-                         users=users,
-                         chart_labels=chart_labels,
-                         chart_transfer=chart_transfer,
-                         chart_reception=chart_reception,
-                         chart_adjustment=chart_adjustment,
-                         chart_inventory=chart_inventory,
-                         chart_total=chart_total)
+                         total_movements=facets['total'],
+                         movements_by_type=facets['by_type'],
+                         stock_items=options['stock_items'],
+                         depots=options['depots'],
+                         vehicles=options['vehicles'],
+                         users=options['users'],
+                         chart_labels=facets['chart_labels'],
+                         chart_transfer=facets['chart_transfer'],
+                         chart_reception=facets['chart_reception'],
+                         chart_adjustment=facets['chart_adjustment'],
+                         chart_inventory=facets['chart_inventory'],
+                         chart_total=facets['chart_total'])
 
-@stocks_bp.route('/movements/export/excel')
+@stocks_bp.route('/api/movements')
 @login_required
-def movements_export_excel():
-    """Export Excel des mouvements avec filtres appliqués"""
+def api_movements_list():
+    """API de la liste des mouvements : page par curseur (after/before) et total approximatif"""
     if not can_access_movements(current_user):
-        flash("Vous n'avez pas la permission d'exporter les données.", "error")
-        return redirect(url_for('stocks.movements_list'))
+        return jsonify({'error': 'Permission refusée'}), 403
     
-    import pandas as pd
-    from sqlalchemy import or_
+    from utils_region_filter import get_region_scope
     
-    # Récupérer les mêmes filtres que movements_list
-    movement_type = request.args.get('type', '')
-    search = request.args.get('search', '').strip()
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    stock_item_id = request.args.get('stock_item_id', type=int)
-    depot_id = request.args.get('depot_id', type=int)
-    vehicle_id = request.args.get('vehicle_id', type=int)
-    user_id = request.args.get('user_id', type=int)
+    query, filters = _movements_list_query(request.args)
+    page = movement_listing.keyset_page(query, after=request.args.get('after'),
+                                        before=request.args.get('before'),
+                                        per_page=_movements_per_page(request.args))
+    total_count, total_capped = movement_listing.approximate_count(query, get_region_scope(), filters)
     
-    try:
-        # Construire la requête (même logique que movements_list)
-        query = StockMovement.query.options(
-            joinedload(StockMovement.stock_item),
-            joinedload(StockMovement.from_depot),
-            joinedload(StockMovement.to_depot),
-            joinedload(StockMovement.from_vehicle),
-            joinedload(StockMovement.to_vehicle),
-            joinedload(StockMovement.user)
-        )
-        
-        # Appliquer les filtres
-        if movement_type:
-            query = query.filter(StockMovement.movement_type == movement_type)
-        
-        if search:
-            query = query.filter(
-                or_(
-                    StockMovement.reference.like(f'%{search}%'),
-                    StockMovement.supplier_name.like(f'%{search}%'),
-                    StockMovement.bl_number.like(f'%{search}%')
-                )
+    return jsonify({
+        'movements': [{
+            'id': m.id,
+            'reference': m.reference,
+            'type': m.movement_type,
+            'date': m.movement_date.isoformat() if m.movement_date else None,
+            'article': {'id': m.stock_item_id, 'sku': m.stock_item.sku, 'name': m.stock_item.name} if m.stock_item else None,
+            'quantity': float(m.quantity),
+            'from_depot': m.from_depot.name if m.from_depot else None,
+            'to_depot': m.to_depot.name if m.to_depot else None,
+            'from_vehicle': m.from_vehicle.plate_number if m.from_vehicle else None,
+            'to_vehicle': m.to_vehicle.plate_number if m.to_vehicle else None,
+            'user': m.user.username if m.user else None
+        } for m in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'total': total_count,
+        'total_capped': total_capped
+    })
+
+MOVEMENT_EXPORT_COLUMNS = ['Date', 'Référence', 'Type', 'Article (SKU)', 'Article', 'Quantité', 'Source',
+                           'Destination', 'Utilisateur', 'BL/Fournisseur', 'Raison']
+
+
+@export_engine.exporter('stocks.movements', sheet_name='Mouvements', filename='mouvements_stock',
+                        columns=MOVEMENT_EXPORT_COLUMNS, totals=['Quantité'])
+def _export_movements(args):
+    """Requête et lignes de l'export des mouvements (mêmes filtres que movements_list)"""
+    movement_type = args.get('type', '')
+    search = args.get('search', '').strip()
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    stock_item_id = args.get('stock_item_id', type=int)
+    depot_id = args.get('depot_id', type=int)
+    vehicle_id = args.get('vehicle_id', type=int)
+    user_id = args.get('user_id', type=int)
+    
+    query = StockMovement.query.options(
+        joinedload(StockMovement.stock_item),
+        joinedload(StockMovement.from_depot),
+        joinedload(StockMovement.to_depot),
+        joinedload(StockMovement.from_vehicle),
+        joinedload(StockMovement.to_vehicle),
+        joinedload(StockMovement.user)
+    )
+    
+    # Appliquer les filtres
+    if movement_type:
+        query = query.filter(StockMovement.movement_type == movement_type)
+    
+    if search:
+        query = query.filter(
+            or_(
+                StockMovement.reference.like(f'%{search}%'),
+                StockMovement.supplier_name.like(f'%{search}%'),
+                StockMovement.bl_number.like(f'%{search}%')
             )
-        
-        if date_from:
-            try:
-                date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-                query = query.filter(StockMovement.movement_date >= date_from_obj)
-            except ValueError:
-                pass
-        
-        if date_to:
-            try:
-                date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
-                query = query.filter(StockMovement.movement_date < date_to_obj)
-            except ValueError:
-                pass
-        
-        if stock_item_id:
-            query = query.filter(StockMovement.stock_item_id == stock_item_id)
-        
-        if depot_id:
-            query = query.filter(
-                or_(
-                    StockMovement.from_depot_id == depot_id,
-                    StockMovement.to_depot_id == depot_id
-                )
+        )
+    
+    if date_from:
+        try:
+            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
+            query = query.filter(StockMovement.movement_date >= date_from_obj)
+        except ValueError:
+            pass
+    
+    if date_to:
+        try:
+            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+            query = query.filter(StockMovement.movement_date < date_to_obj)
+        except ValueError:
+            pass
+    
+    if stock_item_id:
+        query = query.filter(StockMovement.stock_item_id == stock_item_id)
+    
+    if depot_id:
+        query = query.filter(
+            or_(
+                StockMovement.from_depot_id == depot_id,
+                StockMovement.to_depot_id == depot_id
             )
-        
-        if vehicle_id:
-            query = query.filter(
-                or_(
-                    StockMovement.from_vehicle_id == vehicle_id,
-                    StockMovement.to_vehicle_id == vehicle_id
-                )
+        )
+    
+    if vehicle_id:
+        query = query.filter(
+            or_(
+                StockMovement.from_vehicle_id == vehicle_id,
+                StockMovement.to_vehicle_id == vehicle_id
             )
-        
-        if user_id:
-            query = query.filter(StockMovement.user_id == user_id)
-        
-        # Récupérer tous les mouvements (sans pagination pour l'export)
-        movements = query.order_by(StockMovement.movement_date.desc()).all()
-        
-        # Préparer les données pour Excel
-        data = []
+        )
+    
+    if user_id:
+        query = query.filter(StockMovement.user_id == user_id)
+    
+    def rows(movements):
         for movement in movements:
             source = ''
             if movement.from_depot:
@@ -739,62 +646,32 @@ def movements_export_excel():
             elif movement.supplier_name:
                 destination = f"Fournisseur: {movement.supplier_name}"
             
-            data.append({
-                'Date': movement.movement_date.strftime('%d/%m/%Y %H:%M') if movement.movement_date else '',
-                'Référence': movement.reference or '',
-                'Type': movement.movement_type.title() if movement.movement_type else '',
-                'Article (SKU)': movement.stock_item.sku if movement.stock_item else '',
-                'Article': movement.stock_item.name if movement.stock_item else '',
-                'Quantité': float(movement.quantity),
-                'Source': source,
-                'Destination': destination,
-                'Utilisateur': movement.user.username if movement.user else '',
-                'BL/Fournisseur': movement.bl_number or movement.supplier_name or '',
-                'Raison': movement.reason or ''
-            })
-        
-        # Créer le DataFrame
-        df = pd.DataFrame(data)
-        
-        # Ajouter une ligne de totaux
-        if len(df) > 0:
-            total_row = pd.DataFrame([{
-                'Date': 'TOTAL',
-                'Référence': '',
-                'Type': '',
-                'Article (SKU)': '',
-                'Article': '',
-                'Quantité': df['Quantité'].sum(),
-                'Source': '',
-                'Destination': '',
-                'Utilisateur': '',
-                'BL/Fournisseur': '',
-                'Raison': ''
-            }])
-            df = pd.concat([df, total_row], ignore_index=True)
-        
-        # Créer le fichier Excel
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Mouvements', index=False)
-            
-            # Formater les colonnes
-            worksheet = writer.sheets['Mouvements']
-            for idx, col in enumerate(df.columns, 1):
-                max_length = max(
-                    df[col].astype(str).map(len).max(),
-                    len(str(col))
-                )
-                worksheet.column_dimensions[chr(64 + idx)].width = min(max_length + 2, 40)
-        
-        output.seek(0)
-        filename = f'mouvements_stock_{datetime.now(UTC).strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
-        
+            yield [
+                movement.movement_date.strftime('%d/%m/%Y %H:%M') if movement.movement_date else '',
+                movement.reference or '',
+                movement.movement_type.title() if movement.movement_type else '',
+                movement.stock_item.sku if movement.stock_item else '',
+                movement.stock_item.name if movement.stock_item else '',
+                float(movement.quantity),
+                source,
+                destination,
+                movement.user.username if movement.user else '',
+                movement.bl_number or movement.supplier_name or '',
+                movement.reason or ''
+            ]
+    
+    return query.order_by(StockMovement.movement_date.desc(), StockMovement.id.desc()), rows
+
+@stocks_bp.route('/movements/export/excel')
+@login_required
+def movements_export_excel():
+    """Export Excel (ou CSV avec format=csv) des mouvements avec filtres appliqués"""
+    if not can_access_movements(current_user):
+        flash("Vous n'avez pas la permission d'exporter les données.", "error")
+        return redirect(url_for('stocks.movements_list'))
+    
+    try:
+        return export_engine.export_response('stocks.movements')
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -802,6 +679,24 @@ def movements_export_excel():
         flash(f'Erreur lors de l\'export Excel: {str(e)}', 'error')
         return redirect(url_for('stocks.movements_list'))
 
+def find_movement_batch(reference):
+    """
+    Bon d'une référence : référence du bon elle-même ou référence d'une de ses lignes
+    (deux recherches sur des colonnes uniques indexées)
+    """
+    batch = StockMovementBatch.query.filter_by(reference=reference).first()
+    if batch is None:
+        line = StockMovement.query.filter_by(reference=reference).first()
+        batch = line.batch if line else None
+    return batch
+
+def _batch_lines_query(reference):
+    """(bon, requête des lignes) d'une référence de bon ou de ligne"""
+    batch = find_movement_batch(reference)
+    if batch is not None:
+        return batch, StockMovement.query.filter(StockMovement.batch_id == batch.id)
+    return None, StockMovement.query.filter(StockMovement.reference == reference)
+
 @stocks_bp.route('/movements/<reference>')
 @login_required
 def movement_detail_by_reference(reference):
@@ -810,17 +705,10 @@ def movement_detail_by_reference(reference):
         flash('Vous n\'avez pas la permission d\'accéder à cette page', 'error')
         return redirect(url_for('stocks.movements_list'))
     
-    # Extraire la référence de base pour regrouper tous les mouvements du même transfert
-    base_ref = extract_base_reference(reference)
-    
-    # Rechercher tous les mouvements avec cette référence de base
-    # Utiliser une requête qui cherche la référence exacte OU les références qui commencent par la base
-    movements = StockMovement.query.filter(
-        or_(
-            StockMovement.reference == reference,
-            StockMovement.reference.like(f'{base_ref}%')
-        )
-    ).options(
+    # Toutes les lignes du bon (transfert multi-articles) par son identifiant
+    batch, lines_query = _batch_lines_query(reference)
+    base_ref = batch.reference if batch else reference
+    movements = lines_query.options(
         joinedload(StockMovement.stock_item),
         joinedload(StockMovement.from_depot),
         joinedload(StockMovement.to_depot),
@@ -876,18 +764,13 @@ def movement_edit(id):
     movement = StockMovement.query.get_or_404(id)
     
     # Pour les transferts, vérifier s'il y a plusieurs articles dans le même bon
-    base_ref = extract_base_reference(movement.reference) if movement.reference else None
+    base_ref = movement.batch.reference if movement.batch else movement.reference
     all_movements = []
     movements_by_item = {}
     
-    if movement.movement_type == 'transfer' and base_ref:
-        # Récupérer tous les mouvements du même transfert
-        all_movements = StockMovement.query.filter(
-            or_(
-                StockMovement.reference == movement.reference,
-                StockMovement.reference.like(f'{base_ref}%')
-            )
-        ).options(
+    if movement.movement_type == 'transfer' and movement.batch:
+        # Récupérer toutes les lignes du même bon
+        all_movements = StockMovement.query.filter(StockMovement.batch_id == movement.batch_id).options(
             joinedload(StockMovement.stock_item),
             joinedload(StockMovement.from_depot),
             joinedload(StockMovement.to_depot),
@@ -978,6 +861,7 @@ def movement_edit(id):
             if movement.movement_type == 'transfer' and len(movements_by_item) > 1:
                 # Traiter chaque article du transfert
                 errors = []
+                stock_deltas = []
                 for item_id, item_data in movements_by_item.items():
                     # Récupérer les quantités OUT et IN séparément
                     quantity_out_str = request.form.get(f'quantity_out_{item_id}')
@@ -1002,170 +886,30 @@ def movement_edit(id):
                             continue
                     except (ValueError, TypeError, InvalidOperation):
                         errors.append(f"Quantités invalides pour {item_data['item'].name if item_data['item'] else 'article inconnu'}")
-                        continue
-                    
-                    # Mettre à jour le mouvement OUT (sortie)
-                    if item_data['movement_out']:
-                        mov_out = item_data['movement_out']
-                        old_quantity_out = abs(mov_out.quantity)
-                        quantity_diff_out = new_quantity_out - old_quantity_out
-                        
-                        # Mettre à jour le mouvement OUT
-                        mov_out.movement_date = movement_date
-                        mov_out.quantity = -new_quantity_out  # Négatif pour sortie
-                        if reason:
-                            mov_out.reason = reason
-                        if supplier_name:
-                            mov_out.supplier_name = supplier_name
-                        if bl_number:
-                            mov_out.bl_number = bl_number
-                        
-                        # Ajuster le stock source si nécessaire
-                        if quantity_diff_out != 0:
-                            if mov_out.from_depot_id:
-                                depot_stock = DepotStock.query.filter_by(
-                                    depot_id=mov_out.from_depot_id,
-                                    stock_item_id=item_id
-                                ).first()
-                                if depot_stock:
-                                    # Si on augmente la sortie, vérifier le stock
-                                    if quantity_diff_out > 0:
-                                        new_stock_qty = depot_stock.quantity - quantity_diff_out
-                                        if new_stock_qty < 0:
-                                            from models import Depot
-                                            depot = Depot.query.get(mov_out.from_depot_id)
-                                            depot_name = depot.name if depot else 'N/A'
-                                            errors.append(f"Stock insuffisant pour {item_data['item'].name if item_data['item'] else 'article'} dans le dépôt source ({depot_name})")
-                                            continue
-                                    depot_stock.quantity -= quantity_diff_out
-                            
-                            if mov_out.from_vehicle_id:
-                                vehicle_stock = VehicleStock.query.filter_by(
-                                    vehicle_id=mov_out.from_vehicle_id,
-                                    stock_item_id=item_id
-                                ).first()
-                                if vehicle_stock:
-                                    if quantity_diff_out > 0:
-                                        new_stock_qty = vehicle_stock.quantity - quantity_diff_out
-                                        if new_stock_qty < 0:
-                                            errors.append(f"Stock insuffisant pour {item_data['item'].name if item_data['item'] else 'article'} dans le véhicule source")
-                                            continue
-                                    vehicle_stock.quantity -= quantity_diff_out
+                        continue
                     
-                    # Mettre à jour le mouvement IN (entrée)
-                    if item_data['movement_in']:
-                        mov_in = item_data['movement_in']
-                        old_quantity_in = mov_in.quantity
-                        quantity_diff_in = new_quantity_in - old_quantity_in
-                        
-                        # Mettre à jour le mouvement IN
-                        mov_in.movement_date = movement_date
-                        mov_in.quantity = new_quantity_in  # Positif pour entrée
-                        if reason:
-                            mov_in.reason = reason
-                        if supplier_name:
-                            mov_in.supplier_name = supplier_name
-                        if bl_number:
-                            mov_in.bl_number = bl_number
-                        
-                        # Ajuster le stock destination si nécessaire
-                        if quantity_diff_in != 0:
-                            if mov_in.to_depot_id:
-                                depot_stock = DepotStock.query.filter_by(
-                                    depot_id=mov_in.to_depot_id,
-                                    stock_item_id=item_id
-                                ).first()
-                                if not depot_stock:
-                                    depot_stock = DepotStock(
-                                        depot_id=mov_in.to_depot_id,
-                                        stock_item_id=item_id,
-                                        quantity=Decimal('0')
-                                    )
-                                    db.session.add(depot_stock)
-                                depot_stock.quantity += quantity_diff_in
-                            
-                            if mov_in.to_vehicle_id:
-                                vehicle_stock = VehicleStock.query.filter_by(
-                                    vehicle_id=mov_in.to_vehicle_id,
-                                    stock_item_id=item_id
-                                ).first()
-                                if not vehicle_stock:
-                                    vehicle_stock = VehicleStock(
-                                        vehicle_id=mov_in.to_vehicle_id,
-                                        stock_item_id=item_id,
-                                        quantity=Decimal('0')
-                                    )
-                                    db.session.add(vehicle_stock)
-                                vehicle_stock.quantity += quantity_diff_in
-                        
-                        # Mettre à jour le mouvement
+                    # Mettre à jour les mouvements OUT (sortie, négatif) et IN (entrée, positif) ;
+                    # les variations de stock sont appliquées ensemble après la boucle
+                    for mov, new_signed_quantity in ((item_data['movement_out'], -new_quantity_out),
+                                                     (item_data['movement_in'], new_quantity_in)):
+                        if not mov:
+                            continue
+                        stock_deltas.extend(stock_mutations.movement_change_deltas(mov, new_signed_quantity))
                         mov.movement_date = movement_date
-                        mov.quantity = signed_quantity
+                        mov.quantity = new_signed_quantity
                         if reason:
                             mov.reason = reason
                         if supplier_name:
                             mov.supplier_name = supplier_name
                         if bl_number:
                             mov.bl_number = bl_number
-                        
-                        # Ajuster le stock si nécessaire
-                        if quantity_diff != 0:
-                            # Pour les sorties (négatif)
-                            if mov.from_depot_id:
-                                depot_stock = DepotStock.query.filter_by(
-                                    depot_id=mov.from_depot_id,
-                                    stock_item_id=item_id
-                                ).first()
-                                if depot_stock:
-                                    # Si on augmente la sortie (quantity_diff négatif), vérifier le stock
-                                    if quantity_diff < 0:
-                                        new_stock_qty = depot_stock.quantity - quantity_diff  # quantity_diff est négatif
-                                        if new_stock_qty < 0:
-                                            errors.append(f"Stock insuffisant pour {item_data['item'].name if item_data['item'] else 'article'} dans le dépôt source")
-                                            continue
-                                    depot_stock.quantity -= quantity_diff  # Inverser car c'est une sortie
-                            
-                            if mov.from_vehicle_id:
-                                vehicle_stock = VehicleStock.query.filter_by(
-                                    vehicle_id=mov.from_vehicle_id,
-                                    stock_item_id=item_id
-                                ).first()
-                                if vehicle_stock:
-                                    if quantity_diff < 0:
-                                        new_stock_qty = vehicle_stock.quantity - quantity_diff
-                                        if new_stock_qty < 0:
-                                            errors.append(f"Stock insuffisant pour {item_data['item'].name if item_data['item'] else 'article'} dans le véhicule source")
-                                            continue
-                                    vehicle_stock.quantity -= quantity_diff
-                            
-                            # Pour les entrées (positif)
-                            if mov.to_depot_id:
-                                depot_stock = DepotStock.query.filter_by(
-                                    depot_id=mov.to_depot_id,
-                                    stock_item_id=item_id
-                                ).first()
-                                if not depot_stock:
-                                    depot_stock = DepotStock(
-                                        depot_id=mov.to_depot_id,
-                                        stock_item_id=item_id,
-                                        quantity=Decimal('0')
-                                    )
-                                    db.session.add(depot_stock)
-                                depot_stock.quantity += quantity_diff
-                            
-                            if mov.to_vehicle_id:
-                                vehicle_stock = VehicleStock.query.filter_by(
-                                    vehicle_id=mov.to_vehicle_id,
-                                    stock_item_id=item_id
-                                ).first()
-                                if not vehicle_stock:
-                                    vehicle_stock = VehicleStock(
-                                        vehicle_id=mov.to_vehicle_id,
-                                        stock_item_id=item_id,
-                                        quantity=Decimal('0')
-                                    )
-                                    db.session.add(vehicle_stock)
-                                vehicle_stock.quantity += quantity_diff
+                
+                # Stocks source et destination ajustés en une passe, lignes verrouillées
+                if not errors:
+                    try:
+                        stock_mutations.apply_stock_deltas(stock_deltas)
+                    except stock_mutations.InsufficientStockError as e:
+                        errors.extend(insufficient_stock_messages(e, "Stock insuffisant après modification pour"))
                 
                 if errors:
                     db.session.rollback()
@@ -1214,9 +958,8 @@ def movement_edit(id):
                 else:
                     signed_quantity = abs(quantity)
                 
-                # Calculer l'ancienne quantité pour ajuster le stock
-                old_quantity = movement.quantity
-                quantity_diff = signed_quantity - old_quantity
+                # Variations de stock induites par le changement de quantité (règle du grand livre)
+                stock_deltas = stock_mutations.movement_change_deltas(movement, signed_quantity)
                 
                 # Mettre à jour le mouvement
                 movement.movement_date = movement_date
@@ -1225,104 +968,19 @@ def movement_edit(id):
                 movement.supplier_name = supplier_name if supplier_name else movement.supplier_name
                 movement.bl_number = bl_number if bl_number else movement.bl_number
                 
-                # Ajuster le stock si nécessaire
-                if quantity_diff != 0:
-                    # Vérifier le stock disponible avant modification
-                    if movement.from_depot_id:
-                        depot_stock = DepotStock.query.filter_by(
-                            depot_id=movement.from_depot_id,
-                            stock_item_id=movement.stock_item_id
-                        ).first()
-                        if depot_stock:
-                            # Si on augmente la sortie (quantity_diff négatif), vérifier le stock
-                            if quantity_diff < 0:
-                                new_quantity = depot_stock.quantity - quantity_diff  # quantity_diff est négatif, donc soustraction
-                                if new_quantity < 0:
-                                    flash(f'Stock insuffisant après modification pour {movement.stock_item.name if movement.stock_item else "l\'article"}', 'error')
-                                    form_data = get_movement_form_data()
-                                    return render_template('stocks/movement_edit.html', 
-                                                         movement=movement, 
-                                                         all_movements=all_movements,
-                                                         movements_by_item=movements_by_item,
-                                                         base_reference=base_ref,
-                                                         **form_data)
-                    
-                    if movement.from_vehicle_id:
-                        vehicle_stock = VehicleStock.query.filter_by(
-                            vehicle_id=movement.from_vehicle_id,
-                            stock_item_id=movement.stock_item_id
-                        ).first()
-                        if vehicle_stock:
-                            # Si on augmente la sortie (quantity_diff négatif), vérifier le stock
-                            if quantity_diff < 0:
-                                new_quantity = vehicle_stock.quantity - quantity_diff  # quantity_diff est négatif, donc soustraction
-                                if new_quantity < 0:
-                                    flash(f'Stock insuffisant après modification pour {movement.stock_item.name if movement.stock_item else "l\'article"}', 'error')
-                                    form_data = get_movement_form_data()
-                                    return render_template('stocks/movement_edit.html',
-                                                     movement=movement, 
-                                                     all_movements=all_movements,
-                                                     movements_by_item=movements_by_item,
-                                                     base_reference=base_ref,
-                                                     **form_data)
-                    
-                    # Si le mouvement a une destination (entrée)
-                    if movement.to_depot_id:
-                        depot_stock = DepotStock.query.filter_by(
-                            depot_id=movement.to_depot_id,
-                            stock_item_id=movement.stock_item_id
-                        ).first()
-                        if not depot_stock:
-                            depot_stock = DepotStock(
-                                depot_id=movement.to_depot_id,
-                                stock_item_id=movement.stock_item_id,
-                                quantity=Decimal('0')
-                            )
-                            db.session.add(depot_stock)
-                        depot_stock.quantity += quantity_diff
-                    
-                    if movement.to_vehicle_id:
-                        vehicle_stock = VehicleStock.query.filter_by(
-                            vehicle_id=movement.to_vehicle_id,
-                            stock_item_id=movement.stock_item_id
-                        ).first()
-                        if not vehicle_stock:
-                            vehicle_stock = VehicleStock(
-                                vehicle_id=movement.to_vehicle_id,
-                                stock_item_id=movement.stock_item_id,
-                                quantity=Decimal('0')
-                            )
-                            db.session.add(vehicle_stock)
-                        vehicle_stock.quantity += quantity_diff
-                    
-                    # Si le mouvement a une source (sortie)
-                    if movement.from_depot_id:
-                        depot_stock = DepotStock.query.filter_by(
-                            depot_id=movement.from_depot_id,
-                            stock_item_id=movement.stock_item_id
-                        ).first()
-                        if not depot_stock:
-                            depot_stock = DepotStock(
-                                depot_id=movement.from_depot_id,
-                                stock_item_id=movement.stock_item_id,
-                                quantity=Decimal('0')
-                            )
-                            db.session.add(depot_stock)
-                        depot_stock.quantity -= quantity_diff  # Inverser car c'est une sortie
-                    
-                    if movement.from_vehicle_id:
-                        vehicle_stock = VehicleStock.query.filter_by(
-                            vehicle_id=movement.from_vehicle_id,
-                            stock_item_id=movement.stock_item_id
-                        ).first()
-                        if not vehicle_stock:
-                            vehicle_stock = VehicleStock(
-                                vehicle_id=movement.from_vehicle_id,
-                                stock_item_id=movement.stock_item_id,
-                                quantity=Decimal('0')
-                            )
-                            db.session.add(vehicle_stock)
-                        vehicle_stock.quantity -= quantity_diff  # Inverser car c'est une sortie
+                # Ajuster le stock (le solde ne peut pas devenir négatif)
+                try:
+                    stock_mutations.apply_stock_deltas(stock_deltas)
+                except stock_mutations.InsufficientStockError as e:
+                    db.session.rollback()
+                    flash("; ".join(insufficient_stock_messages(e, "Stock insuffisant après modification pour")), 'error')
+                    form_data = get_movement_form_data()
+                    return render_template('stocks/movement_edit.html', 
+                                         movement=movement, 
+                                         all_movements=all_movements,
+                                         movements_by_item=movements_by_item,
+                                         base_reference=base_ref,
+                                         **form_data)
                 
                 db.session.commit()
                 flash('Mouvement modifié avec succès', 'success')
@@ -1418,41 +1076,26 @@ def movement_delete(id):
                     flash('Ce mouvement est lié à un retour client. Supprimez d\'abord le retour.', 'error')
                     return redirect(url_for('stocks.movement_detail_by_reference', reference=reference))
         
-        # Ajuster le stock en sens inverse
+        # Ajuster le stock en sens inverse (variations atomiques, sans contrôle de
+        # solde : la suppression d'une entrée déjà consommée reste possible)
+        reverse_deltas = []
         if movement.quantity > 0:
             # C'était une entrée, on doit diminuer le stock
             if movement.to_depot_id:
-                depot_stock = DepotStock.query.filter_by(
-                    depot_id=movement.to_depot_id,
-                    stock_item_id=movement.stock_item_id
-                ).first()
-                if depot_stock:
-                    depot_stock.quantity -= movement.quantity
-            
+                reverse_deltas.append(stock_mutations.depot_delta(
+                    movement.to_depot_id, movement.stock_item_id, -movement.quantity))
             if movement.to_vehicle_id:
-                vehicle_stock = VehicleStock.query.filter_by(
-                    vehicle_id=movement.to_vehicle_id,
-                    stock_item_id=movement.stock_item_id
-                ).first()
-                if vehicle_stock:
-                    vehicle_stock.quantity -= movement.quantity
+                reverse_deltas.append(stock_mutations.vehicle_delta(
+                    movement.to_vehicle_id, movement.stock_item_id, -movement.quantity))
         else:
             # C'était une sortie, on doit augmenter le stock
             if movement.from_depot_id:
-                depot_stock = DepotStock.query.filter_by(
-                    depot_id=movement.from_depot_id,
-                    stock_item_id=movement.stock_item_id
-                ).first()
-                if depot_stock:
-                    depot_stock.quantity += abs(movement.quantity)
-            
+                reverse_deltas.append(stock_mutations.depot_delta(
+                    movement.from_depot_id, movement.stock_item_id, abs(movement.quantity)))
             if movement.from_vehicle_id:
-                vehicle_stock = VehicleStock.query.filter_by(
-                    vehicle_id=movement.from_vehicle_id,
-                    stock_item_id=movement.stock_item_id
-                ).first()
-                if vehicle_stock:
-                    vehicle_stock.quantity += abs(movement.quantity)
+                reverse_deltas.append(stock_mutations.vehicle_delta(
+                    movement.from_vehicle_id, movement.stock_item_id, abs(movement.quantity)))
+        stock_mutations.apply_stock_deltas(reverse_deltas, allow_negative=True)
         
         # Supprimer le mouvement
         db.session.delete(movement)
@@ -1469,8 +1112,11 @@ def movement_delete(id):
 @stocks_bp.route('/api/movements/<reference>')
 @login_required
 def api_movement_by_reference(reference):
-    """API pour récupérer un mouvement par sa référence"""
-    movements = StockMovement.query.filter_by(reference=reference).all()
+    """API pour récupérer les mouvements d'une référence (ligne ou bon complet)"""
+    batch, lines_query = _batch_lines_query(reference)
+    if batch is not None and batch.reference != reference:
+        lines_query = StockMovement.query.filter_by(reference=reference)  # une ligne précise
+    movements = lines_query.order_by(StockMovement.id).all()
     
     if not movements:
         return jsonify({
@@ -1482,6 +1128,12 @@ def api_movement_by_reference(reference):
         'found': True,
         'reference': reference,
         'count': len(movements),
+        'batch': {
+            'id': batch.id,
+            'reference': batch.reference,
+            'lines_count': batch.lines_count,
+            'items_count': batch.items_count
+        } if batch else None,
         'movements': []
     }
     
@@ -1614,7 +1266,10 @@ def movement_new():
                 
                 movements_created = 0
                 errors = []
-                generated_references = []  # Pour éviter les doublons dans la même transaction
+                movement_rows = []
+                # Une référence de bon pour tout le transfert : lignes BASE-OUT/BASE-IN, BASE-OUT-2/BASE-IN-2...
+                base_reference = generate_movement_reference(movement_type)
+                line_number = 0
                 
                 # Transaction atomique : traiter tous les articles ou aucun
                 try:
@@ -1631,111 +1286,15 @@ def movement_new():
                                 errors.append(f"Quantité invalide pour l'article {i+1}")
                                 continue
                             
-                            # Vérifier le stock source et créer s'il n'existe pas
-                            source_stock = None
-                            
-                            if from_depot_id:
-                                # Récupérer le stock du dépôt (source principale)
-                                source_stock = DepotStock.query.filter_by(
-                                    depot_id=int(from_depot_id), 
-                                    stock_item_id=stock_item_id
-                                ).first()
-                                
-                                # Si le stock n'existe pas, le créer avec quantité 0
-                                if not source_stock:
-                                    source_stock = DepotStock(
-                                        depot_id=int(from_depot_id),
-                                        stock_item_id=stock_item_id,
-                                        quantity=Decimal('0')
-                                    )
-                                    db.session.add(source_stock)
-                                    # Flush pour s'assurer que l'objet est dans la session
-                                    db.session.flush()
-                                
-                                # Rafraîchir l'objet depuis la base de données pour avoir la valeur la plus récente
-                                db.session.refresh(source_stock)
-                                
-                                # Utiliser directement la quantité de DepotStock
-                                available_quantity = source_stock.quantity or Decimal('0')
-                                
-                                # Debug: afficher les valeurs pour diagnostic
-                                print(f"🔍 DEBUG Stock - Dépôt: {from_depot_id}, Article: {stock_item_id}, Disponible: {available_quantity}, Requis: {quantity}")
-                                
-                                # Vérifier le stock disponible avec arrondi pour éviter les problèmes de précision
-                                quantity_decimal = Decimal(str(quantity)).quantize(Decimal('0.0001'))
-                                available_decimal = available_quantity.quantize(Decimal('0.0001'))
-                                
-                                if available_decimal < quantity_decimal:
-                                    item = StockItem.query.get(stock_item_id)
-                                    item_name = item.name if item else f"ID {stock_item_id}"
-                                    # Formater les quantités pour l'affichage (éviter les décimales inutiles)
-                                    available_display = f"{available_quantity:.4f}".rstrip('0').rstrip('.')
-                                    quantity_display = f"{quantity:.4f}".rstrip('0').rstrip('.')
-                                    errors.append(f"Stock insuffisant à la source pour {item_name} (disponible: {available_display}, requis: {quantity_display})")
-                                    continue
-                                
-                                # Déduire la quantité du stock source
-                                source_stock.quantity -= quantity_decimal
-                            
-                            elif from_vehicle_id:
-                                source_stock = VehicleStock.query.filter_by(
-                                    vehicle_id=int(from_vehicle_id), 
-                                    stock_item_id=stock_item_id
-                                ).first()
-                                if not source_stock:
-                                    # Créer le stock avec quantité 0
-                                    source_stock = VehicleStock(
-                                        vehicle_id=int(from_vehicle_id),
-                                        stock_item_id=stock_item_id,
-                                        quantity=Decimal('0')
-                                    )
-                                    db.session.add(source_stock)
-                                # Vérifier le stock disponible
-                                if source_stock.quantity < quantity:
-                                    item = StockItem.query.get(stock_item_id)
-                                    item_name = item.name if item else f"ID {stock_item_id}"
-                                    errors.append(f"Stock insuffisant à la source pour {item_name} (disponible: {source_stock.quantity}, requis: {quantity})")
-                                    continue
-                                # Déduire la quantité du stock source
-                                source_stock.quantity -= quantity
-                            
-                            else:
+                            # La disponibilité à la source est vérifiée par stock_mutations
+                            # dans l'instruction qui la décrémente (voir après la boucle)
+                            if not from_depot_id and not from_vehicle_id:
                                 # Aucune source définie (ne devrait pas arriver pour un transfert)
                                 errors.append(f"Aucune source définie pour le transfert de l'article {stock_item_id}")
                                 continue
+                            quantity = Decimal(str(quantity)).quantize(Decimal('0.0001'))
                             
-                            # Mettre à jour le stock destination
-                            if to_depot_id:
-                                dest_stock = DepotStock.query.filter_by(
-                                    depot_id=int(to_depot_id), 
-                                    stock_item_id=stock_item_id
-                                ).first()
-                                if not dest_stock:
-                                    dest_stock = DepotStock(
-                                        depot_id=int(to_depot_id),
-                                        stock_item_id=stock_item_id,
-                                        quantity=Decimal('0')
-                                    )
-                                    db.session.add(dest_stock)
-                                dest_stock.quantity += quantity
-                            
-                            elif to_vehicle_id:
-                                dest_stock = VehicleStock.query.filter_by(
-                                    vehicle_id=int(to_vehicle_id), 
-                                    stock_item_id=stock_item_id
-                                ).first()
-                                if not dest_stock:
-                                    dest_stock = VehicleStock(
-                                        vehicle_id=int(to_vehicle_id),
-                                        stock_item_id=stock_item_id,
-                                        quantity=Decimal('0')
-                                    )
-                                    db.session.add(dest_stock)
-                                dest_stock.quantity += quantity
-                            
-                            # Générer une référence de base pour ce transfert
-                            base_reference = generate_movement_reference(movement_type, generated_references)
-                            generated_references.append(base_reference)
+                            line_number += 1
                             
                             # LOGIQUE MÉTIER : TRANSFERT = Déplacement entre dépôts/véhicules
                             # Créer les mouvements avec signe :
@@ -1757,26 +1316,14 @@ def movement_new():
                             else:
                                 movement_date = datetime.now()
                             
-                            # Générer des références uniques pour chaque mouvement
-                            # Pour les transferts, nous créons deux mouvements (sortie et entrée)
-                            # avec des références différentes pour éviter la contrainte unique
-                            reference_out = f"{base_reference}-OUT"
-                            reference_in = f"{base_reference}-IN"
-                            
-                            # Vérifier et ajuster si nécessaire pour éviter les doublons
-                            counter = 1
-                            while StockMovement.query.filter_by(reference=reference_out).first():
-                                reference_out = f"{base_reference}-OUT-{counter}"
-                                counter += 1
-                            
-                            counter = 1
-                            while StockMovement.query.filter_by(reference=reference_in).first():
-                                reference_in = f"{base_reference}-IN-{counter}"
-                                counter += 1
+                            # Références des lignes du bon : sortie et entrée de chaque article
+                            # (la référence de base est unique, compteur du jour : pas de vérification en base)
+                            reference_out = movement_batches.line_reference(base_reference, 'OUT', line_number)
+                            reference_in = movement_batches.line_reference(base_reference, 'IN', line_number)
                             
                             # Mouvement SORTIE (si source existe)
                             if from_depot_id or from_vehicle_id:
-                                movement_out = StockMovement(
+                                movement_rows.append(dict(
                                     reference=reference_out,
                                     movement_type=movement_type,
                                     movement_date=movement_date,
@@ -1788,14 +1335,13 @@ def movement_new():
                                     to_depot_id=None,
                                     to_vehicle_id=None,
                                     reason=reason
-                                )
-                                db.session.add(movement_out)
+                                ))
                                 movements_created += 1
                                 print(f"✅ Mouvement SORTIE créé: {reference_out} - Article {stock_item_id} - Quantité: -{quantity} (Dépôt/Véhicule source: {from_depot_id or from_vehicle_id})")
                             
                             # Mouvement ENTRÉE (si destination existe)
                             if to_depot_id or to_vehicle_id:
-                                movement_in = StockMovement(
+                                movement_rows.append(dict(
                                     reference=reference_in,
                                     movement_type=movement_type,
                                     movement_date=movement_date,
@@ -1807,14 +1353,20 @@ def movement_new():
                                     to_depot_id=int(to_depot_id) if to_depot_id else None,
                                     to_vehicle_id=int(to_vehicle_id) if to_vehicle_id else None,
                                     reason=reason
-                                )
-                                db.session.add(movement_in)
+                                ))
                                 movements_created += 1
                             print(f"✅ Mouvement ENTRÉE créé: {reference_in} - Article {stock_item_id} - Quantité: +{quantity} (Dépôt/Véhicule destination: {to_depot_id or to_vehicle_id})")
                             
                         except (ValueError, IndexError) as e:
                             errors.append(f"Erreur lors du traitement de l'article {i+1}: {str(e)}")
                             continue
+                    
+                    # Stocks source et destination mis à jour en une passe, lignes verrouillées
+                    if not errors and movement_rows:
+                        try:
+                            stock_mutations.record_movements(movement_rows)
+                        except stock_mutations.InsufficientStockError as e:
+                            errors.extend(insufficient_stock_messages(e, "Stock insuffisant à la source pour"))
                 
                     if errors:
                         db.session.rollback()
@@ -1862,64 +1414,29 @@ def movement_new():
                     return render_template('stocks/movement_form.html', movement_type=movement_type, **form_data)
                 
                 if movement_type == 'reception':
-                    # Réception : incrémenter dépôt
+                    # Réception : incrémenter dépôt (via stock_mutations à l'enregistrement du mouvement)
                     if not to_depot_id:
                         flash('Veuillez sélectionner un dépôt de destination', 'error')
                         form_data = get_movement_form_data()
                         return render_template('stocks/movement_form.html', movement_type=movement_type, **form_data)
-                    
-                    dest_stock = DepotStock.query.filter_by(
-                        depot_id=int(to_depot_id), 
-                        stock_item_id=stock_item_id
-                    ).first()
-                    if not dest_stock:
-                        dest_stock = DepotStock(
-                            depot_id=int(to_depot_id),
-                            stock_item_id=stock_item_id,
-                            quantity=Decimal('0')
-                        )
-                        db.session.add(dest_stock)
-                    dest_stock.quantity += quantity
                 
                 elif movement_type == 'adjustment':
-                    # Ajustement : calculer la différence AVANT de mettre à jour le stock
+                    # Ajustement : lire le niveau actuel sous verrou AVANT de calculer la différence
                     depot_id = to_depot_id or from_depot_id
                     vehicle_id = to_vehicle_id or from_vehicle_id
                     
-                    old_quantity = Decimal('0')
+                    if not depot_id and not vehicle_id:
+                        flash('Veuillez sélectionner un dépôt ou un véhicule à ajuster', 'error')
+                        form_data = get_movement_form_data()
+                        return render_template('stocks/movement_form.html', movement_type=movement_type, **form_data)
                     if depot_id:
-                        stock = DepotStock.query.filter_by(
-                            depot_id=int(depot_id), 
-                            stock_item_id=stock_item_id
-                        ).first()
-                        if stock:
-                            old_quantity = stock.quantity
-                        else:
-                            stock = DepotStock(
-                                depot_id=int(depot_id),
-                                stock_item_id=stock_item_id,
-                                quantity=Decimal('0')
-                            )
-                            db.session.add(stock)
-                    elif vehicle_id:
-                        stock = VehicleStock.query.filter_by(
-                            vehicle_id=int(vehicle_id), 
-                            stock_item_id=stock_item_id
-                        ).first()
-                        if stock:
-                            old_quantity = stock.quantity
-                        else:
-                            stock = VehicleStock(
-                                vehicle_id=int(vehicle_id),
-                                stock_item_id=stock_item_id,
-                                quantity=Decimal('0')
-                            )
-                            db.session.add(stock)
+                        stock_key = (stock_mutations.LOCATION_DEPOT, int(depot_id), stock_item_id)
+                    else:
+                        stock_key = (stock_mutations.LOCATION_VEHICLE, int(vehicle_id), stock_item_id)
+                    old_quantity = stock_mutations.get_levels([stock_key], lock=True)[stock_key]
                     
-                    # Calculer la différence
+                    # Calculer la différence (appliquée au stock avec le mouvement)
                     adjustment_diff = quantity - old_quantity
-                    # Mettre à jour le stock (cache)
-                    stock.quantity = quantity
                 
                 # Générer une référence unique pour ce mouvement
                 reference = generate_movement_reference(movement_type)
@@ -1945,92 +1462,55 @@ def movement_new():
                     movement_date = datetime.now(UTC)
                 
                 # Déterminer le signe de la quantité selon le type de mouvement
+                common = dict(
+                    reference=reference,
+                    movement_type=movement_type,
+                    movement_date=movement_date,
+                    stock_item_id=stock_item_id,
+                    user_id=current_user.id,
+                    supplier_name=supplier_name,
+                    bl_number=bl_number,
+                    reason=reason
+                )
                 if movement_type == 'reception':
                     # LOGIQUE MÉTIER : RÉCEPTION = Augmentation du stock
                     # Réception = ENTRÉE = quantité POSITIVE (augmente le stock)
-                    signed_quantity = quantity
-                    # Créer le mouvement ENTRÉE
-                    movement = StockMovement(
-                        reference=reference,
-                        movement_type=movement_type,
-                        movement_date=movement_date,
-                        stock_item_id=stock_item_id,
-                        quantity=signed_quantity,  # POSITIF
-                        user_id=current_user.id,
-                        from_depot_id=None,
-                        from_vehicle_id=None,
+                    stock_mutations.record_movements([dict(
+                        common,
+                        quantity=quantity,  # POSITIF
                         to_depot_id=int(to_depot_id) if to_depot_id else None,
-                        to_vehicle_id=int(to_vehicle_id) if to_vehicle_id else None,
-                        supplier_name=supplier_name,
-                        bl_number=bl_number,
-                        reason=reason
-                    )
+                        to_vehicle_id=int(to_vehicle_id) if to_vehicle_id else None
+                    )])
                 elif movement_type == 'adjustment':
-                    # Ajustement : utiliser la différence calculée précédemment
-                    depot_id = to_depot_id or from_depot_id
-                    vehicle_id = to_vehicle_id or from_vehicle_id
-                    
-                    # Utiliser la différence calculée (positif si augmentation, négatif si diminution)
-                    signed_quantity = adjustment_diff if 'adjustment_diff' in locals() else quantity
-                    
-                    if signed_quantity > 0:
-                        # Ajustement positif (ajout)
-                        movement = StockMovement(
-                            reference=reference,
-                            movement_type=movement_type,
-                            movement_date=movement_date,
-                            stock_item_id=stock_item_id,
-                            quantity=signed_quantity,  # POSITIF
-                            user_id=current_user.id,
-                            from_depot_id=None,
-                            from_vehicle_id=None,
-                            to_depot_id=int(to_depot_id) if to_depot_id else None,
-                            to_vehicle_id=int(to_vehicle_id) if to_vehicle_id else None,
-                            supplier_name=supplier_name,
-                            bl_number=bl_number,
-                            reason=reason
-                        )
-                    elif signed_quantity < 0:
-                        # Ajustement négatif (retrait)
-                        movement = StockMovement(
-                            reference=reference,
-                            movement_type=movement_type,
-                            movement_date=movement_date,
-                            stock_item_id=stock_item_id,
-                            quantity=signed_quantity,  # NÉGATIF
-                            user_id=current_user.id,
-                            from_depot_id=int(from_depot_id) if from_depot_id else None,
-                            from_vehicle_id=int(from_vehicle_id) if from_vehicle_id else None,
-                            to_depot_id=None,
-                            to_vehicle_id=None,
-                            supplier_name=supplier_name,
-                            bl_number=bl_number,
-                            reason=reason
-                        )
-                    else:
+                    # Ajustement : utiliser la différence calculée précédemment, sur
+                    # l'emplacement ajusté (entrée si positive, sortie si négative)
+                    signed_quantity = adjustment_diff
+                    location_id = stock_key[1]
+                    if signed_quantity == 0:
                         # Aucun ajustement nécessaire (quantité identique)
+                        db.session.rollback()
                         flash('Aucun ajustement nécessaire (quantité identique)', 'info')
                         form_data = get_movement_form_data()
                         return render_template('stocks/movement_form.html', movement_type=movement_type, **form_data)
+                    direction = 'to' if signed_quantity > 0 else 'from'
+                    location_column = 'depot_id' if stock_key[0] == stock_mutations.LOCATION_DEPOT else 'vehicle_id'
+                    # Le niveau final est celui saisi : solde négatif impossible, pas de contrôle supplémentaire
+                    stock_mutations.record_movements([dict(
+                        common,
+                        quantity=signed_quantity,  # POSITIF (ajout) ou NÉGATIF (retrait)
+                        **{f'{direction}_{location_column}': location_id}
+                    )], allow_negative=True)
                 else:
-                    # Par défaut, positif (ne devrait pas arriver ici normalement)
-                    movement = StockMovement(
-                        reference=reference,
-                        movement_type=movement_type,
-                        movement_date=movement_date,
-                        stock_item_id=stock_item_id,
+                    # Par défaut, positif (ne devrait pas arriver ici normalement) : sans effet sur les stocks
+                    db.session.add(StockMovement(
                         quantity=quantity,
-                        user_id=current_user.id,
                         from_depot_id=int(from_depot_id) if from_depot_id else None,
                         from_vehicle_id=int(from_vehicle_id) if from_vehicle_id else None,
                         to_depot_id=int(to_depot_id) if to_depot_id else None,
                         to_vehicle_id=int(to_vehicle_id) if to_vehicle_id else None,
-                        supplier_name=supplier_name,
-                        bl_number=bl_number,
-                        reason=reason
-                    )
+                        **common
+                    ))
                 
-                db.session.add(movement)
                 db.session.commit()
                 
                 flash(f'Mouvement de type "{movement_type}" créé avec succès', 'success')
@@ -2044,7 +1524,7 @@ def movement_new():
     
     form_data = get_movement_form_data()
     # Générer une référence prévisualisée
-    preview_reference = generate_movement_reference(movement_type)
+    preview_reference = reference_sequences.peek_reference(MOVEMENT_REFERENCE_PREFIXES.get(movement_type, 'MV'))
     return render_template('stocks/movement_form.html', 
                          movement_type=movement_type,
                          current_user=current_user,
@@ -2149,148 +1629,95 @@ def receptions_list():
                          total_receptions=total_receptions,
                          depots=depots)
 
+RECEPTION_EXPORT_COLUMNS = ['Date', 'Référence', 'Dépôt', 'Fournisseur', 'BL', 'Article (SKU)', 'Article',
+                            'Quantité', 'Prix Unitaire (GNF)', 'Montant Total (GNF)', 'Utilisateur', 'Statut', 'Notes']
+
+
+@export_engine.exporter('stocks.receptions', sheet_name='Réceptions', filename='receptions_stock',
+                        columns=RECEPTION_EXPORT_COLUMNS, totals=['Quantité', 'Montant Total (GNF)'])
+def _export_receptions(args):
+    """Requête et lignes de l'export des réceptions (une ligne par détail, mêmes filtres que receptions_list)"""
+    search = args.get('search', '').strip()
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    depot_id = args.get('depot_id', type=int)
+    supplier_name = args.get('supplier_name', '').strip()
+    
+    # Détails chargés par lot (selectinload) : compatible avec la lecture par lots
+    query = Reception.query.options(
+        joinedload(Reception.depot),
+        joinedload(Reception.user),
+        selectinload(Reception.details).joinedload(ReceptionDetail.stock_item)
+    )
+    
+    # Appliquer les filtres
+    if search:
+        query = query.filter(
+            or_(
+                Reception.reference.like(f'%{search}%'),
+                Reception.bl_number.like(f'%{search}%'),
+                Reception.supplier_name.like(f'%{search}%')
+            )
+        )
+    
+    if date_from:
+        try:
+            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
+            query = query.filter(Reception.reception_date >= date_from_obj)
+        except ValueError:
+            pass
+    
+    if date_to:
+        try:
+            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+            query = query.filter(Reception.reception_date < date_to_obj)
+        except ValueError:
+            pass
+    
+    if depot_id:
+        query = query.filter(Reception.depot_id == depot_id)
+    
+    if supplier_name:
+        query = query.filter(Reception.supplier_name.like(f'%{supplier_name}%'))
+    
+    def rows(receptions):
+        for reception in receptions:
+            head = [
+                reception.reception_date.strftime('%d/%m/%Y') if reception.reception_date else '',
+                reception.reference or '',
+                reception.depot.name if reception.depot else '',
+                reception.supplier_name or '',
+                reception.bl_number or '',
+            ]
+            tail = [
+                reception.user.username if reception.user else '',
+                reception.status or 'draft',
+                reception.notes or ''
+            ]
+            if not reception.details:
+                # Réception sans détails
+                yield head + ['', '', 0, 0, 0] + tail
+            for detail in reception.details:
+                yield head + [
+                    detail.stock_item.sku if detail.stock_item else '',
+                    detail.stock_item.name if detail.stock_item else '',
+                    float(detail.quantity),
+                    float(detail.unit_price_gnf) if detail.unit_price_gnf else 0,
+                    float(detail.quantity * detail.unit_price_gnf) if detail.unit_price_gnf else 0,
+                ] + tail
+    
+    return query.order_by(Reception.reception_date.desc(), Reception.id.desc()), rows
+
 @stocks_bp.route('/receptions/export/excel')
 @login_required
 def receptions_export_excel():
-    """Export Excel des réceptions avec filtres appliqués"""
+    """Export Excel (ou CSV avec format=csv) des réceptions avec filtres appliqués"""
     if not can_access_receptions(current_user):
         flash("Vous n'avez pas la permission d'exporter les données.", "error")
         return redirect(url_for('stocks.receptions_list'))
     
-    import pandas as pd
-    from sqlalchemy import or_
-    
-    # Récupérer les mêmes filtres que receptions_list
-    search = request.args.get('search', '').strip()
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    depot_id = request.args.get('depot_id', type=int)
-    supplier_name = request.args.get('supplier_name', '').strip()
-    
     try:
-        # Construire la requête (même logique que receptions_list)
-        query = Reception.query.options(
-            joinedload(Reception.depot),
-            joinedload(Reception.user),
-            joinedload(Reception.details).joinedload(ReceptionDetail.stock_item)
-        )
-        
-        # Appliquer les filtres
-        if search:
-            query = query.filter(
-                or_(
-                    Reception.reference.like(f'%{search}%'),
-                    Reception.bl_number.like(f'%{search}%'),
-                    Reception.supplier_name.like(f'%{search}%')
-                )
-            )
-        
-        if date_from:
-            try:
-                date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-                query = query.filter(Reception.reception_date >= date_from_obj)
-            except ValueError:
-                pass
-        
-        if date_to:
-            try:
-                date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
-                query = query.filter(Reception.reception_date < date_to_obj)
-            except ValueError:
-                pass
-        
-        if depot_id:
-            query = query.filter(Reception.depot_id == depot_id)
-        
-        if supplier_name:
-            query = query.filter(Reception.supplier_name.like(f'%{supplier_name}%'))
-        
-        # Récupérer toutes les réceptions (sans pagination pour l'export)
-        receptions = query.order_by(Reception.reception_date.desc()).all()
-        
-        # Préparer les données pour Excel
-        data = []
-        for reception in receptions:
-            # Une ligne par détail de réception
-            if reception.details:
-                for detail in reception.details:
-                    data.append({
-                        'Date': reception.reception_date.strftime('%d/%m/%Y') if reception.reception_date else '',
-                        'Référence': reception.reference or '',
-                        'Dépôt': reception.depot.name if reception.depot else '',
-                        'Fournisseur': reception.supplier_name or '',
-                        'BL': reception.bl_number or '',
-                        'Article (SKU)': detail.stock_item.sku if detail.stock_item else '',
-                        'Article': detail.stock_item.name if detail.stock_item else '',
-                        'Quantité': float(detail.quantity),
-                        'Prix Unitaire (GNF)': float(detail.unit_price_gnf) if detail.unit_price_gnf else 0,
-                        'Montant Total (GNF)': float(detail.quantity * detail.unit_price_gnf) if detail.unit_price_gnf else 0,
-                        'Utilisateur': reception.user.username if reception.user else '',
-                        'Statut': reception.status or 'draft',
-                        'Notes': reception.notes or ''
-                    })
-            else:
-                # Réception sans détails
-                data.append({
-                    'Date': reception.reception_date.strftime('%d/%m/%Y') if reception.reception_date else '',
-                    'Référence': reception.reference or '',
-                    'Dépôt': reception.depot.name if reception.depot else '',
-                    'Fournisseur': reception.supplier_name or '',
-                    'BL': reception.bl_number or '',
-                    'Article (SKU)': '',
-                    'Article': '',
-                    'Quantité': 0,
-                    'Prix Unitaire (GNF)': 0,
-                    'Montant Total (GNF)': 0,
-                    'Utilisateur': reception.user.username if reception.user else '',
-                    'Statut': reception.status or 'draft',
-                    'Notes': reception.notes or ''
-                })
-        
-        # Créer le DataFrame
-        df = pd.DataFrame(data)
-        
-        # Ajouter une ligne de totaux
-        if len(df) > 0:
-            total_row = pd.DataFrame([{
-                'Date': 'TOTAL',
-                'Référence': '',
-                'Dépôt': '',
-                'Fournisseur': '',
-                'BL': '',
-                'Article (SKU)': '',
-                'Article': '',
-                'Quantité': df['Quantité'].sum(),
-                'Prix Unitaire (GNF)': '',
-                'Montant Total (GNF)': df['Montant Total (GNF)'].sum(),
-                'Utilisateur': '',
-                'Statut': '',
-                'Notes': ''
-            }])
-            df = pd.concat([df, total_row], ignore_index=True)
-        
-        # Créer le fichier Excel
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Réceptions', index=False)
-            
-            # Formater les colonnes
-            worksheet = writer.sheets['Réceptions']
-            for idx, col in enumerate(df.columns, 1):
-                max_length = max(
-                    df[col].astype(str).map(len).max(),
-                    len(str(col))
-                )
-                worksheet.column_dimensions[chr(64 + idx)].width = min(max_length + 2, 40)
-        
-        output.seek(0)
-        filename = f'receptions_stock_{datetime.now(UTC).strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
-        
+        return export_engine.export_response('stocks.receptions')
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -2369,6 +1796,7 @@ def reception_new():
             return render_template('stocks/reception_form.html', depots=depots, stock_items=stock_items)
         
         # Créer les détails
+        movement_rows = []
         for item_data in items_data:
             if item_data:
                 parts = item_data.split(',')
@@ -2400,23 +1828,9 @@ def reception_new():
                     )
                     db.session.add(detail)
                     
-                    # Mettre à jour le stock du dépôt (cache)
-                    depot_stock = DepotStock.query.filter_by(
-                        depot_id=depot_id,
-                        stock_item_id=item_id
-                    ).first()
-                    if not depot_stock:
-                        depot_stock = DepotStock(
-                            depot_id=depot_id,
-                            stock_item_id=item_id,
-                            quantity=Decimal('0')
-                        )
-                        db.session.add(depot_stock)
-                    depot_stock.quantity += qty
-                    
                     # LOGIQUE MÉTIER : RÉCEPTION = Augmentation du stock (entrée externe)
-                    # Créer le mouvement de stock (ENTRÉE = quantité POSITIVE)
-                    movement_ref = generate_movement_reference('reception')
+                    # Mouvement de stock (ENTRÉE = quantité POSITIVE) ; le stock du dépôt est
+                    # mis à jour par stock_mutations à l'enregistrement des mouvements
                     # Utiliser la date de réception déjà parsée
                     movement_date = reception.reception_date
                     # S'assurer que la date est en UTC
@@ -2431,21 +1845,22 @@ def reception_new():
                     elif not movement_date:
                         movement_date = datetime.now(UTC)
                     
-                    movement = StockMovement(
-                        reference=movement_ref,
+                    movement_rows.append(dict(
                         movement_type='reception',
                         movement_date=movement_date,
                         stock_item_id=item_id,
                         quantity=qty,  # POSITIF pour entrée
                         user_id=current_user.id,
-                        from_depot_id=None,
-                        from_vehicle_id=None,
                         to_depot_id=depot_id,
-                        to_vehicle_id=None,
                         supplier_name=supplier_name,
                         bl_number=bl_number
-                    )
-                    db.session.add(movement)
+                    ))
+        
+        # Références réservées en un bloc, stock du dépôt et mouvements écrits en une passe
+        for row, movement_ref in zip(movement_rows, reference_sequences.reserve_references(
+                MOVEMENT_REFERENCE_PREFIXES['reception'], len(movement_rows))):
+            row['reference'] = movement_ref
+        stock_mutations.record_movements(movement_rows)
         
         reception.status = 'completed'
         db.session.commit()
@@ -2616,200 +2031,134 @@ def outgoings_list():
     # Statistiques
     total_outgoings = StockOutgoing.query.count()
     
-    # Données pour filtres (filtrées par région)
-    depots_query = Depot.query.filter_by(is_active=True)
-    depots_query = filter_depots_by_region(depots_query)
-    depots = depots_query.order_by(Depot.name).all()
-    vehicles_query = Vehicle.query.filter_by(status='active')
-    vehicles_query = filter_vehicles_by_region(vehicles_query)
-    vehicles = vehicles_query.order_by(Vehicle.plate_number).all()
+    # Données pour filtres (filtrées par région)
+    depots_query = Depot.query.filter_by(is_active=True)
+    depots_query = filter_depots_by_region(depots_query)
+    depots = depots_query.order_by(Depot.name).all()
+    vehicles_query = Vehicle.query.filter_by(status='active')
+    vehicles_query = filter_vehicles_by_region(vehicles_query)
+    vehicles = vehicles_query.order_by(Vehicle.plate_number).all()
+    
+    return render_template('stocks/outgoings_list.html', 
+                         outgoings=outgoings,
+                         pagination=pagination,
+                         search=search,
+                         date_from=date_from,
+                         date_to=date_to,
+                         depot_id=depot_id,
+                         vehicle_id=vehicle_id,
+                         client_name=client_name,
+                         per_page=per_page,
+                         total_outgoings=total_outgoings,
+                         depots=depots,
+                         vehicles=vehicles)
+
+OUTGOING_EXPORT_COLUMNS = ['Date', 'Référence', 'Client', 'Téléphone', 'Dépôt', 'Véhicule', 'Commercial',
+                           'Article (SKU)', 'Article', 'Quantité', 'Prix Unitaire (GNF)', 'Montant Total (GNF)',
+                           'Utilisateur', 'Statut', 'Notes']
+
+
+@export_engine.exporter('stocks.outgoings', sheet_name='Sorties', filename='sorties_stock',
+                        columns=OUTGOING_EXPORT_COLUMNS, totals=['Quantité', 'Montant Total (GNF)'])
+def _export_outgoings(args):
+    """Requête et lignes de l'export des sorties (une ligne par détail, mêmes filtres que outgoings_list)"""
+    from utils_region_filter import filter_outgoings_by_region
+    search = args.get('search', '').strip()
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    depot_id = args.get('depot_id', type=int)
+    vehicle_id = args.get('vehicle_id', type=int)
+    client_name = args.get('client_name', '').strip()
+    
+    # Détails chargés par lot (selectinload) : compatible avec la lecture par lots
+    query = StockOutgoing.query.options(
+        joinedload(StockOutgoing.depot),
+        joinedload(StockOutgoing.vehicle),
+        joinedload(StockOutgoing.commercial),
+        joinedload(StockOutgoing.user),
+        selectinload(StockOutgoing.details).joinedload(StockOutgoingDetail.stock_item)
+    )
+    
+    # IMPORTANT: Filtrer selon le rôle de l'utilisateur (même logique que outgoings_list)
+    if current_user.role and current_user.role.code == 'commercial':
+        query = query.filter(StockOutgoing.commercial_id == current_user.id)
+    elif current_user.role and current_user.role.code not in ['admin', 'superadmin']:
+        # Filtrer par région pour les autres rôles (sous-requêtes du périmètre régional)
+        query = filter_outgoings_by_region(query)
+    
+    # Appliquer les filtres
+    if search:
+        query = query.filter(
+            or_(
+                StockOutgoing.reference.like(f'%{search}%'),
+                StockOutgoing.client_name.like(f'%{search}%'),
+                StockOutgoing.client_phone.like(f'%{search}%')
+            )
+        )
+    
+    if date_from:
+        try:
+            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
+            query = query.filter(StockOutgoing.outgoing_date >= date_from_obj)
+        except ValueError:
+            pass
+    
+    if date_to:
+        try:
+            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+            query = query.filter(StockOutgoing.outgoing_date < date_to_obj)
+        except ValueError:
+            pass
+    
+    if depot_id:
+        query = query.filter(StockOutgoing.depot_id == depot_id)
+    
+    if vehicle_id:
+        query = query.filter(StockOutgoing.vehicle_id == vehicle_id)
+    
+    if client_name:
+        query = query.filter(StockOutgoing.client_name.like(f'%{client_name}%'))
     
-    return render_template('stocks/outgoings_list.html', 
-                         outgoings=outgoings,
-                         pagination=pagination,
-                         search=search,
-                         date_from=date_from,
-                         date_to=date_to,
-                         depot_id=depot_id,
-                         vehicle_id=vehicle_id,
-                         client_name=client_name,
-                         per_page=per_page,
-                         total_outgoings=total_outgoings,
-                         depots=depots,
-                         vehicles=vehicles)
+    def rows(records):
+        for record in records:
+            head = [
+                record.outgoing_date.strftime('%d/%m/%Y') if record.outgoing_date else '',
+                record.reference or '',
+                record.client_name or '',
+                record.client_phone or '',
+                record.depot.name if record.depot else '',
+                record.vehicle.plate_number if record.vehicle else '',
+                record.commercial.username if record.commercial else '',
+            ]
+            tail = [
+                record.user.username if record.user else '',
+                record.status or 'draft',
+                record.notes or ''
+            ]
+            if not record.details:
+                # Sortie sans détails
+                yield head + ['', '', 0, 0, 0] + tail
+            for detail in record.details:
+                yield head + [
+                    detail.stock_item.sku if detail.stock_item else '',
+                    detail.stock_item.name if detail.stock_item else '',
+                    float(detail.quantity),
+                    float(detail.unit_price_gnf) if detail.unit_price_gnf else 0,
+                    float(detail.quantity * detail.unit_price_gnf) if detail.unit_price_gnf else 0,
+                ] + tail
+    
+    return query.order_by(StockOutgoing.outgoing_date.desc(), StockOutgoing.id.desc()), rows
 
 @stocks_bp.route('/outgoings/export/excel')
 @login_required
 def outgoings_export_excel():
-    """Export Excel des sorties avec filtres appliqués"""
+    """Export Excel (ou CSV avec format=csv) des sorties avec filtres appliqués"""
     if not can_access_outgoings(current_user):
         flash("Vous n'avez pas la permission d'exporter les données.", "error")
         return redirect(url_for('stocks.outgoings_list'))
     
-    import pandas as pd
-    from sqlalchemy import or_
-    
-    # Récupérer les mêmes filtres que outgoings_list
-    search = request.args.get('search', '').strip()
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    depot_id = request.args.get('depot_id', type=int)
-    vehicle_id = request.args.get('vehicle_id', type=int)
-    client_name = request.args.get('client_name', '').strip()
-    
     try:
-        # Construire la requête (même logique que outgoings_list)
-        query = StockOutgoing.query.options(
-            joinedload(StockOutgoing.depot),
-            joinedload(StockOutgoing.vehicle),
-            joinedload(StockOutgoing.commercial),
-            joinedload(StockOutgoing.user),
-            joinedload(StockOutgoing.details).joinedload(StockOutgoingDetail.stock_item)
-        )
-        
-        # IMPORTANT: Filtrer selon le rôle de l'utilisateur (même logique que outgoings_list)
-        from utils_region_filter import filter_depots_by_region, filter_vehicles_by_region
-        if current_user.role and current_user.role.code == 'commercial':
-            query = query.filter(StockOutgoing.commercial_id == current_user.id)
-        elif current_user.role and current_user.role.code not in ['admin', 'superadmin']:
-            # Filtrer par région pour les autres rôles
-            accessible_depot_ids = [d.id for d in filter_depots_by_region(Depot.query).all()]
-            accessible_vehicle_ids = [v.id for v in filter_vehicles_by_region(Vehicle.query).all()]
-            if accessible_depot_ids or accessible_vehicle_ids:
-                query = query.filter(
-                    or_(
-                        StockOutgoing.depot_id.in_(accessible_depot_ids) if accessible_depot_ids else False,
-                        StockOutgoing.vehicle_id.in_(accessible_vehicle_ids) if accessible_vehicle_ids else False
-                    )
-                )
-            else:
-                query = query.filter(False)
-        
-        # Appliquer les filtres
-        if search:
-            query = query.filter(
-                or_(
-                    StockOutgoing.reference.like(f'%{search}%'),
-                    StockOutgoing.client_name.like(f'%{search}%'),
-                    StockOutgoing.client_phone.like(f'%{search}%')
-                )
-            )
-        
-        if date_from:
-            try:
-                date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-                query = query.filter(StockOutgoing.outgoing_date >= date_from_obj)
-            except ValueError:
-                pass
-        
-        if date_to:
-            try:
-                date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
-                query = query.filter(StockOutgoing.outgoing_date < date_to_obj)
-            except ValueError:
-                pass
-        
-        if depot_id:
-            query = query.filter(StockOutgoing.depot_id == depot_id)
-        
-        if vehicle_id:
-            query = query.filter(StockOutgoing.vehicle_id == vehicle_id)
-        
-        if client_name:
-            query = query.filter(StockOutgoing.client_name.like(f'%{client_name}%'))
-        
-        # Récupérer toutes les sorties (sans pagination pour l'export)
-        outgoings = query.order_by(StockOutgoing.outgoing_date.desc()).all()
-        
-        # Préparer les données pour Excel
-        data = []
-        for outgoing in outgoings:
-            # Une ligne par détail de sortie
-            if outgoing.details:
-                for detail in outgoing.details:
-                    data.append({
-                        'Date': outgoing.outgoing_date.strftime('%d/%m/%Y') if outgoing.outgoing_date else '',
-                        'Référence': outgoing.reference or '',
-                        'Client': outgoing.client_name or '',
-                        'Téléphone': outgoing.client_phone or '',
-                        'Dépôt': outgoing.depot.name if outgoing.depot else '',
-                        'Véhicule': outgoing.vehicle.plate_number if outgoing.vehicle else '',
-                        'Commercial': outgoing.commercial.username if outgoing.commercial else '',
-                        'Article (SKU)': detail.stock_item.sku if detail.stock_item else '',
-                        'Article': detail.stock_item.name if detail.stock_item else '',
-                        'Quantité': float(detail.quantity),
-                        'Prix Unitaire (GNF)': float(detail.unit_price_gnf) if detail.unit_price_gnf else 0,
-                        'Montant Total (GNF)': float(detail.quantity * detail.unit_price_gnf) if detail.unit_price_gnf else 0,
-                        'Utilisateur': outgoing.user.username if outgoing.user else '',
-                        'Statut': outgoing.status or 'draft',
-                        'Notes': outgoing.notes or ''
-                    })
-            else:
-                # Sortie sans détails
-                data.append({
-                    'Date': outgoing.outgoing_date.strftime('%d/%m/%Y') if outgoing.outgoing_date else '',
-                    'Référence': outgoing.reference or '',
-                    'Client': outgoing.client_name or '',
-                    'Téléphone': outgoing.client_phone or '',
-                    'Dépôt': outgoing.depot.name if outgoing.depot else '',
-                    'Véhicule': outgoing.vehicle.plate_number if outgoing.vehicle else '',
-                    'Commercial': outgoing.commercial.username if outgoing.commercial else '',
-                    'Article (SKU)': '',
-                    'Article': '',
-                    'Quantité': 0,
-                    'Prix Unitaire (GNF)': 0,
-                    'Montant Total (GNF)': 0,
-                    'Utilisateur': outgoing.user.username if outgoing.user else '',
-                    'Statut': outgoing.status or 'draft',
-                    'Notes': outgoing.notes or ''
-                })
-        
-        # Créer le DataFrame
-        df = pd.DataFrame(data)
-        
-        # Ajouter une ligne de totaux
-        if len(df) > 0:
-            total_row = pd.DataFrame([{
-                'Date': 'TOTAL',
-                'Référence': '',
-                'Client': '',
-                'Téléphone': '',
-                'Dépôt': '',
-                'Véhicule': '',
-                'Commercial': '',
-                'Article (SKU)': '',
-                'Article': '',
-                'Quantité': df['Quantité'].sum(),
-                'Prix Unitaire (GNF)': '',
-                'Montant Total (GNF)': df['Montant Total (GNF)'].sum(),
-                'Utilisateur': '',
-                'Statut': '',
-                'Notes': ''
-            }])
-            df = pd.concat([df, total_row], ignore_index=True)
-        
-        # Créer le fichier Excel
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Sorties', index=False)
-            
-            # Formater les colonnes
-            worksheet = writer.sheets['Sorties']
-            for idx, col in enumerate(df.columns, 1):
-                max_length = max(
-                    df[col].astype(str).map(len).max(),
-                    len(str(col))
-                )
-                worksheet.column_dimensions[chr(64 + idx)].width = min(max_length + 2, 40)
-        
-        output.seek(0)
-        filename = f'sorties_stock_{datetime.now(UTC).strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
-        
+        return export_engine.export_response('stocks.outgoings')
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -2885,7 +2234,22 @@ def outgoing_new():
             db.session.rollback()
             return render_template('stocks/outgoing_form.html', **get_outgoing_form_data())
         
-        # Créer les détails et décrémenter les stocks
+        # Convertir outgoing_date si c'est une string
+        movement_date = outgoing.outgoing_date
+        if isinstance(movement_date, str):
+            try:
+                movement_date = datetime.strptime(movement_date, '%Y-%m-%d')
+            except:
+                movement_date = datetime.now()
+        if vehicle_id:
+            source = {'from_vehicle_id': int(vehicle_id)}
+        elif depot_id:
+            source = {'from_depot_id': int(depot_id)}
+        else:
+            source = None
+        
+        # Créer les détails et les mouvements de sortie
+        movement_rows = []
         for item_data in items_data:
             if item_data:
                 parts = item_data.split(',')
@@ -2894,73 +2258,18 @@ def outgoing_new():
                     qty = Decimal(parts[1])
                     unit_price = Decimal(parts[2]) if len(parts) > 2 and parts[2] else None
                     
-                    # Décrémenter le stock (cache)
-                    if vehicle_id:
-                        stock = VehicleStock.query.filter_by(vehicle_id=int(vehicle_id), stock_item_id=item_id).first()
-                        if not stock or stock.quantity < qty:
-                            flash(f'Stock insuffisant pour {StockItem.query.get(item_id).name}', 'error')
-                            db.session.rollback()
-                            return render_template('stocks/outgoing_form.html', **get_outgoing_form_data())
-                        stock.quantity -= qty
-                        
-                        # Créer le mouvement de stock (SORTIE = négatif)
-                        # Utiliser 'transfer' comme type mais avec reason détaillé pour distinguer les sorties clients
-                        movement_ref = generate_movement_reference('transfer')
-                        # Convertir outgoing_date si c'est une string
-                        outgoing_date = outgoing.outgoing_date
-                        if isinstance(outgoing_date, str):
-                            try:
-                                outgoing_date = datetime.strptime(outgoing_date, '%Y-%m-%d')
-                            except:
-                                outgoing_date = datetime.now()
-                        
-                        movement = StockMovement(
-                            reference=movement_ref,
-                            movement_type='transfer',  # Type 'transfer' mais reason indique 'Sortie client'
-                            movement_date=outgoing_date,
-                            stock_item_id=item_id,
-                            quantity=-qty,  # NÉGATIF pour sortie
-                            user_id=current_user.id,
-                            from_depot_id=None,
-                            from_vehicle_id=int(vehicle_id),
-                            to_depot_id=None,
-                            to_vehicle_id=None,
-                            reason=f'[SORTIE_CLIENT] Sortie client: {client_name} - Référence sortie: {outgoing.reference}'
-                        )
-                        db.session.add(movement)
-                    elif depot_id:
-                        stock = DepotStock.query.filter_by(depot_id=int(depot_id), stock_item_id=item_id).first()
-                        if not stock or stock.quantity < qty:
-                            flash(f'Stock insuffisant pour {StockItem.query.get(item_id).name}', 'error')
-                            db.session.rollback()
-                            return render_template('stocks/outgoing_form.html', **get_outgoing_form_data())
-                        stock.quantity -= qty
-                        
-                        # Créer le mouvement de stock (SORTIE = négatif)
+                    if source:
+                        # Mouvement de stock (SORTIE = négatif)
                         # Utiliser 'transfer' comme type mais avec reason détaillé pour distinguer les sorties clients
-                        movement_ref = generate_movement_reference('transfer')
-                        # Convertir outgoing_date si c'est une string
-                        outgoing_date = outgoing.outgoing_date
-                        if isinstance(outgoing_date, str):
-                            try:
-                                outgoing_date = datetime.strptime(outgoing_date, '%Y-%m-%d')
-                            except:
-                                outgoing_date = datetime.now()
-                        
-                        movement = StockMovement(
-                            reference=movement_ref,
+                        movement_rows.append(dict(
                             movement_type='transfer',  # Type 'transfer' mais reason indique 'Sortie client'
-                            movement_date=outgoing_date,
+                            movement_date=movement_date,
                             stock_item_id=item_id,
                             quantity=-qty,  # NÉGATIF pour sortie
                             user_id=current_user.id,
-                            from_depot_id=int(depot_id),
-                            from_vehicle_id=None,
-                            to_depot_id=None,
-                            to_vehicle_id=None,
-                            reason=f'[SORTIE_CLIENT] Sortie client: {client_name} - Référence sortie: {outgoing.reference}'
-                        )
-                        db.session.add(movement)
+                            reason=f'[SORTIE_CLIENT] Sortie client: {client_name} - Référence sortie: {outgoing.reference}',
+                            **source
+                        ))
                     
                     detail = StockOutgoingDetail(
                         outgoing_id=outgoing.id,
@@ -2970,6 +2279,18 @@ def outgoing_new():
                     )
                     db.session.add(detail)
         
+        # Décrémenter les stocks : disponibilité vérifiée dans l'instruction de mise à jour
+        for row, movement_ref in zip(movement_rows, reference_sequences.reserve_references(
+                MOVEMENT_REFERENCE_PREFIXES['transfer'], len(movement_rows))):
+            row['reference'] = movement_ref
+        try:
+            stock_mutations.record_movements(movement_rows)
+        except stock_mutations.InsufficientStockError as e:
+            db.session.rollback()
+            for message in insufficient_stock_messages(e):
+                flash(message, 'error')
+            return render_template('stocks/outgoing_form.html', **get_outgoing_form_data())
+        
         outgoing.status = 'completed'
         db.session.commit()
         
@@ -3241,10 +2562,9 @@ def returns_list():
         # Si l'erreur est due à original_outgoing_id, utiliser une requête SQL directe
         if 'original_outgoing_id' in str(e):
             try:
-                from sqlalchemy import text, inspect
+                from sqlalchemy import text
                 # Vérifier quelles colonnes existent dans la table
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('stock_returns')]
+                columns = schema_registry.get_columns('stock_returns')
                 
                 # Construire la liste des colonnes à sélectionner (sans original_outgoing_id)
                 select_cols = []
@@ -3351,10 +2671,9 @@ def returns_list():
         # Si l'erreur est due à original_outgoing_id, utiliser une requête SQL directe
         if 'original_outgoing_id' in str(e):
             try:
-                from sqlalchemy import text, inspect
+                from sqlalchemy import text
                 # Vérifier quelles colonnes existent dans la table
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('stock_returns')]
+                columns = schema_registry.get_columns('stock_returns')
                 
                 # Construire la liste des colonnes à sélectionner (sans original_outgoing_id)
                 select_cols = []
@@ -3415,186 +2734,127 @@ def returns_list():
                          depots=Depot.query.filter_by(is_active=True).order_by(Depot.name).all(),
                          vehicles=Vehicle.query.filter_by(status='active').order_by(Vehicle.plate_number).all())
 
-@stocks_bp.route('/returns/export/excel')
-@login_required
-def returns_export_excel():
-    """Export Excel des retours avec filtres appliqués"""
-    if not can_access_returns(current_user):
-        flash("Vous n'avez pas la permission d'exporter les données.", "error")
-        return redirect(url_for('stocks.returns_list'))
-    
-    import pandas as pd
-    from sqlalchemy import or_
+RETURN_EXPORT_COLUMNS = ['Date', 'Référence', 'Client', 'Téléphone', 'Dépôt', 'Véhicule', 'Commercial',
+                         'Article (SKU)', 'Article', 'Quantité', 'Raison', 'Utilisateur', 'Statut', 'Notes']
+
+
+@export_engine.exporter('stocks.returns', sheet_name='Retours', filename='retours_stock',
+                        columns=RETURN_EXPORT_COLUMNS, totals=['Quantité'])
+def _export_returns(args):
+    """Requête et lignes de l'export des retours (une ligne par détail, mêmes filtres que returns_list)"""
+    from sqlalchemy.orm import load_only
+    from utils_region_filter import filter_returns_by_region
+    search = args.get('search', '').strip()
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    depot_id = args.get('depot_id', type=int)
+    vehicle_id = args.get('vehicle_id', type=int)
+    client_name = args.get('client_name', '').strip()
+    
+    # load_only : la colonne 'reason' n'existe pas toujours en MySQL (chargée seulement si présente)
+    load_columns = [
+        StockReturn.id, StockReturn.reference, StockReturn.return_date,
+        StockReturn.return_type, StockReturn.client_name, StockReturn.client_phone,
+        StockReturn.original_outgoing_id, StockReturn.original_order_id,
+        StockReturn.supplier_name, StockReturn.original_reception_id,
+        StockReturn.commercial_id, StockReturn.vehicle_id, StockReturn.depot_id,
+        StockReturn.user_id, StockReturn.notes, StockReturn.status,
+        StockReturn.created_at, StockReturn.updated_at
+    ]
+    has_reason = schema_registry.has_column('stock_returns', 'reason')
+    if has_reason:
+        load_columns.append(StockReturn.reason)
+    
+    # Détails chargés par lot (selectinload) : compatible avec la lecture par lots
+    query = StockReturn.query.options(
+        load_only(*load_columns),
+        joinedload(StockReturn.depot),
+        joinedload(StockReturn.vehicle),
+        joinedload(StockReturn.commercial),
+        joinedload(StockReturn.user),
+        selectinload(StockReturn.details).joinedload(StockReturnDetail.stock_item)
+    )
     
-    # Récupérer les mêmes filtres que returns_list
-    search = request.args.get('search', '').strip()
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    depot_id = request.args.get('depot_id', type=int)
-    vehicle_id = request.args.get('vehicle_id', type=int)
-    client_name = request.args.get('client_name', '').strip()
+    # IMPORTANT: Filtrer selon le rôle de l'utilisateur (même logique que returns_list)
+    if current_user.role and current_user.role.code == 'commercial':
+        query = query.filter(StockReturn.commercial_id == current_user.id)
+    elif current_user.role and current_user.role.code not in ['admin', 'superadmin']:
+        # Filtrer par région pour les autres rôles (sous-requêtes du périmètre régional)
+        query = filter_returns_by_region(query)
     
-    try:
-        # Construire la requête (même logique que returns_list)
-        # Utiliser load_only pour éviter de charger la colonne 'reason' qui n'existe pas en MySQL
-        from sqlalchemy.orm import load_only
-        from utils_region_filter import filter_depots_by_region, filter_vehicles_by_region
-        query = StockReturn.query.options(
-            load_only(
-                StockReturn.id, StockReturn.reference, StockReturn.return_date,
-                StockReturn.return_type, StockReturn.client_name, StockReturn.client_phone,
-                StockReturn.original_outgoing_id, StockReturn.original_order_id,
-                StockReturn.supplier_name, StockReturn.original_reception_id,
-                StockReturn.commercial_id, StockReturn.vehicle_id, StockReturn.depot_id,
-                StockReturn.user_id, StockReturn.notes, StockReturn.status,
-                StockReturn.created_at, StockReturn.updated_at
-            ),
-            joinedload(StockReturn.depot),
-            joinedload(StockReturn.vehicle),
-            joinedload(StockReturn.commercial),
-            joinedload(StockReturn.user),
-            joinedload(StockReturn.details).joinedload(StockReturnDetail.stock_item)
-        )
-        
-        # IMPORTANT: Filtrer selon le rôle de l'utilisateur (même logique que returns_list)
-        if current_user.role and current_user.role.code == 'commercial':
-            query = query.filter(StockReturn.commercial_id == current_user.id)
-        elif current_user.role and current_user.role.code not in ['admin', 'superadmin']:
-            # Filtrer par région pour les autres rôles
-            accessible_depot_ids = [d.id for d in filter_depots_by_region(Depot.query).all()]
-            accessible_vehicle_ids = [v.id for v in filter_vehicles_by_region(Vehicle.query).all()]
-            if accessible_depot_ids or accessible_vehicle_ids:
-                query = query.filter(
-                    or_(
-                        StockReturn.depot_id.in_(accessible_depot_ids) if accessible_depot_ids else False,
-                        StockReturn.vehicle_id.in_(accessible_vehicle_ids) if accessible_vehicle_ids else False
-                    )
-                )
-            else:
-                query = query.filter(False)
-        
-        # Appliquer les filtres
-        if search:
-            query = query.filter(
-                or_(
-                    StockReturn.reference.like(f'%{search}%'),
-                    StockReturn.client_name.like(f'%{search}%'),
-                    StockReturn.client_phone.like(f'%{search}%')
-                )
+    # Appliquer les filtres
+    if search:
+        query = query.filter(
+            or_(
+                StockReturn.reference.like(f'%{search}%'),
+                StockReturn.client_name.like(f'%{search}%'),
+                StockReturn.client_phone.like(f'%{search}%')
             )
-        
-        if date_from:
-            try:
-                date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-                query = query.filter(StockReturn.return_date >= date_from_obj)
-            except ValueError:
-                pass
-        
-        if date_to:
-            try:
-                date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
-                query = query.filter(StockReturn.return_date < date_to_obj)
-            except ValueError:
-                pass
-        
-        if depot_id:
-            query = query.filter(StockReturn.depot_id == depot_id)
-        
-        if vehicle_id:
-            query = query.filter(StockReturn.vehicle_id == vehicle_id)
-        
-        if client_name:
-            query = query.filter(StockReturn.client_name.like(f'%{client_name}%'))
-        
-        # Récupérer tous les retours (sans pagination pour l'export)
-        returns = query.order_by(StockReturn.return_date.desc()).all()
-        
-        # Préparer les données pour Excel
-        data = []
-        for return_ in returns:
-            # Une ligne par détail de retour
-            if return_.details:
-                for detail in return_.details:
-                    data.append({
-                        'Date': return_.return_date.strftime('%d/%m/%Y') if return_.return_date else '',
-                        'Référence': return_.reference or '',
-                        'Client': return_.client_name or '',
-                        'Téléphone': return_.client_phone or '',
-                        'Dépôt': return_.depot.name if return_.depot else '',
-                        'Véhicule': return_.vehicle.plate_number if return_.vehicle else '',
-                        'Commercial': return_.commercial.username if return_.commercial else '',
-                        'Article (SKU)': detail.stock_item.sku if detail.stock_item else '',
-                        'Article': detail.stock_item.name if detail.stock_item else '',
-                        'Quantité': float(detail.quantity),
-                        'Raison': getattr(return_, 'reason', None) or '',
-                        'Utilisateur': return_.user.username if return_.user else '',
-                        'Statut': return_.status or 'draft',
-                        'Notes': return_.notes or ''
-                    })
-            else:
-                # Retour sans détails
-                data.append({
-                    'Date': return_.return_date.strftime('%d/%m/%Y') if return_.return_date else '',
-                    'Référence': return_.reference or '',
-                    'Client': return_.client_name or '',
-                    'Téléphone': return_.client_phone or '',
-                    'Dépôt': return_.depot.name if return_.depot else '',
-                    'Véhicule': return_.vehicle.plate_number if return_.vehicle else '',
-                    'Commercial': return_.commercial.username if return_.commercial else '',
-                    'Article (SKU)': '',
-                    'Article': '',
-                    'Quantité': 0,
-                    'Raison': getattr(return_, 'reason', None) or '',
-                    'Utilisateur': return_.user.username if return_.user else '',
-                    'Statut': return_.status or 'draft',
-                    'Notes': return_.notes or ''
-                })
-        
-        # Créer le DataFrame
-        df = pd.DataFrame(data)
-        
-        # Ajouter une ligne de totaux
-        if len(df) > 0:
-            total_row = pd.DataFrame([{
-                'Date': 'TOTAL',
-                'Référence': '',
-                'Client': '',
-                'Téléphone': '',
-                'Dépôt': '',
-                'Véhicule': '',
-                'Commercial': '',
-                'Article (SKU)': '',
-                'Article': '',
-                'Quantité': df['Quantité'].sum(),
-                'Raison': '',
-                'Utilisateur': '',
-                'Statut': '',
-                'Notes': ''
-            }])
-            df = pd.concat([df, total_row], ignore_index=True)
-        
-        # Créer le fichier Excel
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Retours', index=False)
-            
-            # Formater les colonnes
-            worksheet = writer.sheets['Retours']
-            for idx, col in enumerate(df.columns, 1):
-                max_length = max(
-                    df[col].astype(str).map(len).max(),
-                    len(str(col))
-                )
-                worksheet.column_dimensions[chr(64 + idx)].width = min(max_length + 2, 40)
-        
-        output.seek(0)
-        filename = f'retours_stock_{datetime.now(UTC).strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
-        
+        )
+    
+    if date_from:
+        try:
+            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
+            query = query.filter(StockReturn.return_date >= date_from_obj)
+        except ValueError:
+            pass
+    
+    if date_to:
+        try:
+            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+            query = query.filter(StockReturn.return_date < date_to_obj)
+        except ValueError:
+            pass
+    
+    if depot_id:
+        query = query.filter(StockReturn.depot_id == depot_id)
+    
+    if vehicle_id:
+        query = query.filter(StockReturn.vehicle_id == vehicle_id)
+    
+    if client_name:
+        query = query.filter(StockReturn.client_name.like(f'%{client_name}%'))
+    
+    def rows(records):
+        for record in records:
+            head = [
+                record.return_date.strftime('%d/%m/%Y') if record.return_date else '',
+                record.reference or '',
+                record.client_name or '',
+                record.client_phone or '',
+                record.depot.name if record.depot else '',
+                record.vehicle.plate_number if record.vehicle else '',
+                record.commercial.username if record.commercial else '',
+            ]
+            tail = [
+                record.user.username if record.user else '',
+                record.status or 'draft',
+                record.notes or ''
+            ]
+            reason = (record.reason if has_reason else None) or ''
+            if not record.details:
+                # Retour sans détails
+                yield head + ['', '', 0, reason] + tail
+            for detail in record.details:
+                yield head + [
+                    detail.stock_item.sku if detail.stock_item else '',
+                    detail.stock_item.name if detail.stock_item else '',
+                    float(detail.quantity),
+                    reason,
+                ] + tail
+    
+    return query.order_by(StockReturn.return_date.desc(), StockReturn.id.desc()), rows
+
+@stocks_bp.route('/returns/export/excel')
+@login_required
+def returns_export_excel():
+    """Export Excel (ou CSV avec format=csv) des retours avec filtres appliqués"""
+    if not can_access_returns(current_user):
+        flash("Vous n'avez pas la permission d'exporter les données.", "error")
+        return redirect(url_for('stocks.returns_list'))
+    
+    try:
+        return export_engine.export_response('stocks.returns')
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -3701,9 +2961,7 @@ def return_new():
         # Vérifier si la colonne reason existe dans la base de données
         reason_column_exists = False
         try:
-            from sqlalchemy import inspect
-            inspector = inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('stock_returns')]
+            columns = schema_registry.get_columns('stock_returns')
             reason_column_exists = 'reason' in columns
             if not reason_column_exists:
                 print("⚠️ Colonne 'reason' n'existe pas dans stock_returns, elle sera omise")
@@ -3763,6 +3021,7 @@ def return_new():
             return render_template('stocks/return_form.html', **get_return_form_data())
         
         # Créer les détails et gérer les stocks selon le type de retour
+        movement_rows = []
         for item_data in items_data:
             if item_data:
                 parts = item_data.split(',')
@@ -3782,89 +3041,38 @@ def return_new():
                         # RETOUR FOURNISSEUR : Mouvement inverse de réception
                         # Diminue le stock (quantité NÉGATIVE)
                         if depot_id:
-                            # Vérifier que le stock est suffisant
-                            stock = DepotStock.query.filter_by(depot_id=int(depot_id), stock_item_id=item_id).first()
-                            if not stock or stock.quantity < qty:
-                                item = StockItem.query.get(item_id)
-                                item_name = item.name if item else f"ID {item_id}"
-                                available = stock.quantity if stock else Decimal('0')
-                                flash(f'Stock insuffisant pour {item_name} (disponible: {available}, requis: {qty})', 'error')
-                                db.session.rollback()
-                                return render_template('stocks/return_form.html', **get_return_form_data())
-                            
-                            # Diminuer le stock
-                            stock.quantity -= qty
-                            
-                            # Créer le mouvement de stock (SORTIE = négatif)
-                            movement_ref = generate_movement_reference('reception_return')
-                            movement = StockMovement(
-                                reference=movement_ref,
+                            # Mouvement de stock (SORTIE = négatif) ; la disponibilité est
+                            # vérifiée par stock_mutations après la boucle
+                            movement_rows.append(dict(
+                                reference=generate_movement_reference('reception_return'),
                                 movement_type='reception_return',  # Type dédié pour retours fournisseurs
                                 movement_date=return_date_obj,
                                 stock_item_id=item_id,
                                 quantity=-qty,  # NÉGATIF pour diminuer le stock
                                 user_id=current_user.id,
-                                from_depot_id=int(depot_id),  # Source = dépôt
-                                from_vehicle_id=None,
-                                to_depot_id=None,  # Pas de destination (retour externe)
-                                to_vehicle_id=None,
+                                from_depot_id=int(depot_id),  # Source = dépôt, pas de destination (retour externe)
                                 supplier_name=supplier_name,
                                 reason=f'[RETOUR_FOURNISSEUR] Retour vers {supplier_name} - Référence retour: {return_.reference}' + 
                                        (f' - Référence réception: {return_.original_reception.reference}' if return_.original_reception else '')
-                            )
-                            db.session.add(movement)
+                            ))
                         else:
                             flash('Le dépôt source est obligatoire pour un retour fournisseur', 'error')
                             db.session.rollback()
                             return render_template('stocks/return_form.html', **get_return_form_data())
-                    else:
+                    elif vehicle_id or depot_id:
                         # RETOUR CLIENT : Augmente le stock (quantité POSITIVE)
-                        if vehicle_id:
-                            stock = VehicleStock.query.filter_by(vehicle_id=int(vehicle_id), stock_item_id=item_id).first()
-                            if not stock:
-                                stock = VehicleStock(vehicle_id=int(vehicle_id), stock_item_id=item_id, quantity=Decimal('0'))
-                                db.session.add(stock)
-                            stock.quantity += qty
-                            
-                            # Créer le mouvement de stock (ENTRÉE = positif)
-                            movement_ref = generate_movement_reference('transfer')
-                            movement = StockMovement(
-                                reference=movement_ref,
-                                movement_type='transfer',  # Type 'transfer' pour retours clients
-                                movement_date=return_date_obj,
-                                stock_item_id=item_id,
-                                quantity=qty,  # POSITIF pour entrée
-                                user_id=current_user.id,
-                                from_depot_id=None,
-                                from_vehicle_id=None,
-                                to_depot_id=None,
-                                to_vehicle_id=int(vehicle_id),
-                                reason=f'[RETOUR_CLIENT] Retour client: {client_name} - Référence retour: {return_.reference}'
-                            )
-                            db.session.add(movement)
-                        elif depot_id:
-                            stock = DepotStock.query.filter_by(depot_id=int(depot_id), stock_item_id=item_id).first()
-                            if not stock:
-                                stock = DepotStock(depot_id=int(depot_id), stock_item_id=item_id, quantity=Decimal('0'))
-                                db.session.add(stock)
-                            stock.quantity += qty
-                            
-                            # Créer le mouvement de stock (ENTRÉE = positif)
-                            movement_ref = generate_movement_reference('transfer')
-                            movement = StockMovement(
-                                reference=movement_ref,
-                                movement_type='transfer',  # Type 'transfer' pour retours clients
-                                movement_date=return_date_obj,
-                                stock_item_id=item_id,
-                                quantity=qty,  # POSITIF pour entrée
-                                user_id=current_user.id,
-                                from_depot_id=None,
-                                from_vehicle_id=None,
-                                to_depot_id=int(depot_id),
-                                to_vehicle_id=None,
-                                reason=f'[RETOUR_CLIENT] Retour client: {client_name} - Référence retour: {return_.reference}'
-                            )
-                            db.session.add(movement)
+                        # Mouvement de stock (ENTRÉE = positif), véhicule prioritaire sur le dépôt
+                        destination = {'to_vehicle_id': int(vehicle_id)} if vehicle_id else {'to_depot_id': int(depot_id)}
+                        movement_rows.append(dict(
+                            reference=generate_movement_reference('transfer'),
+                            movement_type='transfer',  # Type 'transfer' pour retours clients
+                            movement_date=return_date_obj,
+                            stock_item_id=item_id,
+                            quantity=qty,  # POSITIF pour entrée
+                            user_id=current_user.id,
+                            reason=f'[RETOUR_CLIENT] Retour client: {client_name} - Référence retour: {return_.reference}',
+                            **destination
+                        ))
                     
                     detail = StockReturnDetail(
                         return_id=return_.id,
@@ -3873,6 +3081,15 @@ def return_new():
                     )
                     db.session.add(detail)
         
+        # Stocks et mouvements écrits en une passe (retour fournisseur : stock suffisant exigé)
+        try:
+            stock_mutations.record_movements(movement_rows)
+        except stock_mutations.InsufficientStockError as e:
+            db.session.rollback()
+            for message in insufficient_stock_messages(e):
+                flash(message, 'error')
+            return render_template('stocks/return_form.html', **get_return_form_data())
+        
         return_.status = 'completed'
         db.session.commit()
         
@@ -3911,9 +3128,8 @@ def return_detail(id):
         # Si l'erreur est due à original_outgoing_id, utiliser une requête SQL directe
         if 'original_outgoing_id' in str(e):
             try:
-                from sqlalchemy import text, inspect
-                inspector = inspect(db.engine)
-                columns = [col['name'] for col in inspector.get_columns('stock_returns')]
+                from sqlalchemy import text
+                columns = schema_registry.get_columns('stock_returns')
                 
                 select_cols = []
                 for col in ['id', 'reference', 'return_date', 'client_name', 'client_phone',
@@ -4059,6 +3275,193 @@ def return_pdf(id):
 # RÉCAPITULATIF STOCK RESTANT
 # =========================================================
 
+def resolve_summary_period(period, start_date=None, end_date=None):
+    """
+    Convertit un filtre de période du récapitulatif en bornes (début inclus, fin exclue)
+    Les bornes sont des datetimes naïfs à minuit ; None = pas de borne
+    """
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if period == 'today':
+        return today, None
+    if period == 'week':
+        return today - timedelta(days=today.weekday()), None
+    if period == 'month':
+        return today.replace(day=1), None
+    if period == 'year':
+        return today.replace(month=1, day=1), None
+    if period == 'custom' and start_date and end_date:
+        try:
+            start = datetime.strptime(start_date, '%Y-%m-%d') if isinstance(start_date, str) else start_date
+            end = datetime.strptime(end_date, '%Y-%m-%d') if isinstance(end_date, str) else end_date
+            if not isinstance(start, datetime):
+                start = datetime.combine(start, datetime.min.time())
+            if not isinstance(end, datetime):
+                end = datetime.combine(end, datetime.min.time())
+            return start.replace(tzinfo=None), end.replace(tzinfo=None) + timedelta(days=1)
+        except (ValueError, TypeError):
+            pass
+    return None, None
+
+def compute_stock_summary(period='all', start_date=None, end_date=None, depot_id=None, vehicle_id=None, stock_item_id=None):
+    """
+    Calcule le récapitulatif du stock restant à partir du grand livre des soldes
+    (stock_ledger) : quelques requêtes agrégées quel que soit le nombre d'articles,
+    de dépôts et de véhicules.
+
+    Périmètre :
+    - soldes par dépôt/véhicule : dépôts actifs et véhicules actifs accessibles (région)
+    - stock initial, entrées, sorties : dépôt sélectionné, sinon véhicule sélectionné,
+      sinon tous les emplacements de la région de l'utilisateur
+
+    Returns:
+        dict: period_start, period_end, depots, vehicles, stock_items,
+              rows (une ligne par article actif), depot_stats
+    """
+    from utils_region_filter import filter_depots_by_region, filter_vehicles_by_region, get_region_location_ids
+
+    period_start, period_end = resolve_summary_period(period, start_date, end_date)
+
+    depots = filter_depots_by_region(Depot.query.filter_by(is_active=True)).order_by(Depot.name).all()
+    vehicles = filter_vehicles_by_region(Vehicle.query.filter_by(status='active')).order_by(Vehicle.plate_number).all()
+    accessible_depot_ids = [d.id for d in depots]
+    accessible_vehicle_ids = [v.id for v in vehicles]
+
+    stock_items = StockItem.query.filter_by(is_active=True).order_by(StockItem.name).all()
+
+    result = {
+        'period_start': period_start,
+        'period_end': period_end,
+        'depots': depots,
+        'vehicles': vehicles,
+        'stock_items': stock_items,
+        'rows': [],
+        'depot_stats': [],
+    }
+
+    # Dépôt/véhicule demandé hors du périmètre de l'utilisateur : rien à afficher
+    if (depot_id and depot_id not in accessible_depot_ids) or (vehicle_id and vehicle_id not in accessible_vehicle_ids):
+        return result
+
+    region_depot_ids, region_vehicle_ids = get_region_location_ids()
+    if depot_id:
+        flow_scope = {'depot_ids': [depot_id], 'vehicle_ids': []}
+    elif vehicle_id:
+        flow_scope = {'depot_ids': [], 'vehicle_ids': [vehicle_id]}
+    else:
+        flow_scope = {'depot_ids': region_depot_ids, 'vehicle_ids': region_vehicle_ids}
+
+    item_ids = [stock_item_id] if stock_item_id else None
+
+    # 1. Soldes actuels par emplacement et article (tout le périmètre régional)
+    balances = stock_ledger.get_balances(depot_ids=region_depot_ids, vehicle_ids=region_vehicle_ids)
+
+    # 2. Stock initial (avant la période) sur le périmètre des flux
+    initial_by_item = {}
+    if period_start:
+        initial = stock_ledger.get_balances(stock_item_ids=item_ids, before=period_start, **flow_scope)
+        for (_, _, item_id), qty in initial.items():
+            initial_by_item[item_id] = initial_by_item.get(item_id, Decimal('0')) + qty
+
+    # 3. Entrées / sorties de la période par article
+    flows_by_item = stock_ledger.get_flows(stock_item_ids=item_ids, start=period_start, end=period_end, **flow_scope)
+
+    # Index des soldes : article -> {(type, emplacement): solde}
+    balances_by_item = {}
+    for (location_type, location_id, item_id), qty in balances.items():
+        balances_by_item.setdefault(item_id, {})[(location_type, location_id)] = qty
+
+    balance_depot_ids = [depot_id] if depot_id else accessible_depot_ids
+    balance_vehicle_ids = [vehicle_id] if vehicle_id else accessible_vehicle_ids
+    flow_depot_ids = set(flow_scope['depot_ids']) if flow_scope['depot_ids'] is not None else None
+    flow_vehicle_ids = set(flow_scope['vehicle_ids']) if flow_scope['vehicle_ids'] is not None else None
+
+    for item in stock_items:
+        if stock_item_id and item.id != stock_item_id:
+            continue
+
+        item_balances = balances_by_item.get(item.id, {})
+        depot_balances = {
+            d_id: float(item_balances.get((stock_ledger.LOCATION_DEPOT, d_id), Decimal('0')))
+            for d_id in balance_depot_ids
+        }
+        vehicle_balances = {
+            v_id: float(item_balances.get((stock_ledger.LOCATION_VEHICLE, v_id), Decimal('0')))
+            for v_id in balance_vehicle_ids
+        }
+        total_depot_stock = sum(depot_balances.values())
+        total_vehicle_stock = sum(vehicle_balances.values())
+
+        # Stock actuel sur le périmètre des flux (dépôt, véhicule ou région)
+        current_stock = sum(
+            qty for (location_type, location_id), qty in item_balances.items()
+            if (location_type == stock_ledger.LOCATION_DEPOT and (flow_depot_ids is None or location_id in flow_depot_ids))
+            or (location_type == stock_ledger.LOCATION_VEHICLE and (flow_vehicle_ids is None or location_id in flow_vehicle_ids))
+        )
+
+        flows = flows_by_item.get(item.id, {'in': Decimal('0'), 'out': Decimal('0'), 'count': 0})
+        entries = float(flows['in'])
+        exits = float(flows['out'])
+        initial_stock = initial_by_item.get(item.id, Decimal('0'))
+
+        result['rows'].append({
+            'item': item,
+            'total_stock': total_depot_stock + total_vehicle_stock,
+            'depot_stock': total_depot_stock,
+            'vehicle_stock': total_vehicle_stock,
+            'depot_balances': depot_balances,
+            'vehicle_balances': vehicle_balances,
+            'current_stock': float(current_stock),
+            'entries': entries,
+            'exits': exits,
+            'movements_count': flows['count'],
+            'initial_stock': float(initial_stock),
+            'final_stock_calculated': float(initial_stock) + entries - exits,
+        })
+
+    # 4. Statistiques par dépôt (entrées, sorties, transferts) sur la période
+    depot_flows = stock_ledger.get_flows(
+        depot_ids=accessible_depot_ids, vehicle_ids=[],
+        start=period_start, end=period_end, group_by='location_type'
+    )
+    depot_totals = {}
+    for (location_type, location_id, movement_type), flow in depot_flows.items():
+        totals = depot_totals.setdefault(location_id, {
+            'receptions': Decimal('0'), 'transfers_in': Decimal('0'),
+            'exits': Decimal('0'), 'transfers_out': Decimal('0'), 'count': 0
+        })
+        if movement_type == 'transfer':
+            totals['transfers_in'] += flow['in']
+            totals['transfers_out'] += flow['out']
+        else:
+            totals['receptions'] += flow['in']
+        totals['exits'] += flow['out']
+        totals['count'] += flow['count']
+
+    depot_stock_totals = {}
+    for (location_type, location_id, _), qty in balances.items():
+        if location_type == stock_ledger.LOCATION_DEPOT:
+            depot_stock_totals[location_id] = depot_stock_totals.get(location_id, Decimal('0')) + qty
+
+    for depot in depots:
+        totals = depot_totals.get(depot.id, {})
+        receptions = totals.get('receptions', Decimal('0'))
+        transfers_in = totals.get('transfers_in', Decimal('0'))
+        transfers_out = totals.get('transfers_out', Decimal('0'))
+        result['depot_stats'].append({
+            'depot': depot,
+            'total_receptions': float(receptions),
+            'total_entries': float(receptions + transfers_in),
+            'total_exits': float(totals.get('exits', Decimal('0'))),
+            'total_transfers_in': float(transfers_in),
+            'total_transfers_out': float(transfers_out),
+            'total_transfers': float(transfers_in + transfers_out),
+            'total_stock': float(depot_stock_totals.get(depot.id, Decimal('0'))),
+            'movements_count': totals.get('count', 0),
+        })
+
+    return result
+
 @stocks_bp.route('/summary/preview')
 @login_required
 def stock_summary_preview():
@@ -4067,10 +3470,6 @@ def stock_summary_preview():
         flash('Vous n\'avez pas la permission d\'accéder à cette page', 'error')
         return redirect(url_for('index'))
     
-    from flask import render_template, request
-    from datetime import datetime, UTC, timedelta
-    from sqlalchemy import func, and_, or_
-    
     # Récupérer les paramètres de filtre
     period = request.args.get('period', 'all')
     start_date = request.args.get('start_date')
@@ -4079,186 +3478,30 @@ def stock_summary_preview():
     depot_id = request.args.get('depot_id', type=int)
     vehicle_id = request.args.get('vehicle_id', type=int)
     
-    # Calculer les dates selon la période (même logique que stock_summary)
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    period_start_date = None
-    period_end_date = None
-    
-    if period == 'today':
-        period_start_date = today
-        period_end_date = datetime.now(UTC)
-    elif period == 'week':
-        week_start = today - timedelta(days=today.weekday())
-        period_start_date = week_start
-        period_end_date = datetime.now(UTC)
-    elif period == 'month':
-        month_start = today.replace(day=1)
-        period_start_date = month_start
-        period_end_date = datetime.now(UTC)
-    elif period == 'year':
-        year_start = today.replace(month=1, day=1)
-        period_start_date = year_start
-        period_end_date = datetime.now(UTC)
-    elif period == 'custom' and start_date and end_date:
-        try:
-            start = datetime.strptime(start_date, '%Y-%m-%d')
-            end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-            period_start_date = start.replace(tzinfo=UTC) if start.tzinfo is None else start
-            period_end_date = end.replace(tzinfo=UTC) if end.tzinfo is None else end
-        except:
-            pass
-    
-    # Récupérer les données filtrées par région
-    from utils_region_filter import filter_depots_by_region, filter_stock_movements_by_region
-    depots_query = Depot.query.filter_by(is_active=True)
-    depots_query = filter_depots_by_region(depots_query)
-    accessible_depots = depots_query.all()
-    
-    stock_items = StockItem.query.filter_by(is_active=True).order_by(StockItem.name).all()
+    # Même calcul que stock_summary (grand livre des soldes)
+    summary = compute_stock_summary(
+        period=period, start_date=start_date, end_date=end_date,
+        depot_id=depot_id, vehicle_id=vehicle_id, stock_item_id=stock_item_id
+    )
+    accessible_depots = summary['depots']
     
-    # Préparer les données pour la prévisualisation avec quantités restantes
-    preview_data = []
     depot_name = 'Tous les dépôts'
     if depot_id:
         depot = next((d for d in accessible_depots if d.id == depot_id), None)
         if depot:
             depot_name = depot.name
     
-    # Calculer les quantités restantes pour chaque article (même logique que stock_summary)
-    for item in stock_items:
-        if stock_item_id and item.id != stock_item_id:
-            continue
-        
-        # Calculer le stock initial (avant la période)
-        initial_stock = Decimal('0')
-        if period_start_date:
-            if depot_id:
-                initial_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                    or_(
-                        StockMovement.to_depot_id == depot_id,
-                        StockMovement.from_depot_id == depot_id
-                    )
-                )
-                initial_movements_query = filter_stock_movements_by_region(initial_movements_query)
-                period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-                initial_movements_query = initial_movements_query.filter(StockMovement.movement_date < period_start_naive)
-                initial_movements = initial_movements_query.all()
-                
-                balance = Decimal('0')
-                for m in initial_movements:
-                    if m.to_depot_id == depot_id:
-                        balance += m.quantity
-                    elif m.from_depot_id == depot_id:
-                        balance -= abs(m.quantity)
-                initial_stock = balance
-            elif vehicle_id:
-                initial_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                    or_(
-                        StockMovement.to_vehicle_id == vehicle_id,
-                        StockMovement.from_vehicle_id == vehicle_id
-                    )
-                )
-                initial_movements_query = filter_stock_movements_by_region(initial_movements_query)
-                period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-                initial_movements_query = initial_movements_query.filter(StockMovement.movement_date < period_start_naive)
-                initial_movements = initial_movements_query.all()
-                
-                balance = Decimal('0')
-                for m in initial_movements:
-                    if m.to_vehicle_id == vehicle_id:
-                        balance += m.quantity
-                    elif m.from_vehicle_id == vehicle_id:
-                        balance -= abs(m.quantity)
-                initial_stock = balance
-            else:
-                initial_movements_query = StockMovement.query.filter_by(stock_item_id=item.id)
-                initial_movements_query = filter_stock_movements_by_region(initial_movements_query)
-                period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-                initial_movements_query = initial_movements_query.filter(StockMovement.movement_date < period_start_naive)
-                initial_movements = initial_movements_query.all()
-                for m in initial_movements:
-                    initial_stock += m.quantity
-        
-        # Calculer les mouvements dans la période
-        movements_query = StockMovement.query.filter_by(stock_item_id=item.id)
-        movements_query = filter_stock_movements_by_region(movements_query)
-        if period_start_date:
-            period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-            movements_query = movements_query.filter(StockMovement.movement_date >= period_start_naive)
-        if period_end_date:
-            period_end_naive = period_end_date.replace(tzinfo=None) if period_end_date.tzinfo else period_end_date
-            movements_query = movements_query.filter(StockMovement.movement_date <= period_end_naive)
-        if depot_id:
-            movements_query = movements_query.filter(
-                or_(
-                    StockMovement.from_depot_id == depot_id,
-                    StockMovement.to_depot_id == depot_id
-                )
-            )
-        if vehicle_id:
-            movements_query = movements_query.filter(
-                or_(
-                    StockMovement.from_vehicle_id == vehicle_id,
-                    StockMovement.to_vehicle_id == vehicle_id
-                )
-            )
-        
-        movements = movements_query.all()
-        entries = sum(float(m.quantity) for m in movements if float(m.quantity) > 0)
-        exits = sum(abs(float(m.quantity)) for m in movements if float(m.quantity) < 0)
-        final_stock_calculated = float(initial_stock) + entries - exits
-        
-        # Calculer le stock actuel (balance totale)
-        if depot_id:
-            depot_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                or_(
-                    StockMovement.to_depot_id == depot_id,
-                    StockMovement.from_depot_id == depot_id
-                )
-            )
-            depot_movements_query = filter_stock_movements_by_region(depot_movements_query)
-            depot_movements = depot_movements_query.all()
-            balance = Decimal('0')
-            for m in depot_movements:
-                if m.to_depot_id == depot_id:
-                    balance += m.quantity
-                elif m.from_depot_id == depot_id:
-                    balance -= abs(m.quantity)
-            current_stock = float(balance)
-        elif vehicle_id:
-            vehicle_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                or_(
-                    StockMovement.to_vehicle_id == vehicle_id,
-                    StockMovement.from_vehicle_id == vehicle_id
-                )
-            )
-            vehicle_movements_query = filter_stock_movements_by_region(vehicle_movements_query)
-            vehicle_movements = vehicle_movements_query.all()
-            balance = Decimal('0')
-            for m in vehicle_movements:
-                if m.to_vehicle_id == vehicle_id:
-                    balance += m.quantity
-                elif m.from_vehicle_id == vehicle_id:
-                    balance -= abs(m.quantity)
-            current_stock = float(balance)
-        else:
-            all_movements_query = StockMovement.query.filter_by(stock_item_id=item.id)
-            all_movements_query = filter_stock_movements_by_region(all_movements_query)
-            all_movements = all_movements_query.all()
-            current_stock = float(sum(m.quantity for m in all_movements))
-        
-        # N'afficher que les articles avec du stock restant (stock actuel > 0)
-        if current_stock > 0:
-            preview_data.append({
-                'item': item,
-                'initial_stock': float(initial_stock),
-                'entries': entries,
-                'exits': exits,
-                'final_stock_calculated': final_stock_calculated,
-                'current_stock': current_stock,
-                'movements_count': len(movements),
-                'depot_name': depot_name
-            })
+    # N'afficher que les articles avec du stock restant (stock actuel > 0)
+    preview_data = [{
+        'item': row['item'],
+        'initial_stock': row['initial_stock'],
+        'entries': row['entries'],
+        'exits': row['exits'],
+        'final_stock_calculated': row['final_stock_calculated'],
+        'current_stock': row['current_stock'],
+        'movements_count': row['movements_count'],
+        'depot_name': depot_name
+    } for row in summary['rows'] if row['current_stock'] > 0]
     
     return render_template('stocks/stock_preview.html',
                          preview_data=preview_data,
@@ -4269,7 +3512,7 @@ def stock_summary_preview():
                          depot_id=depot_id,
                          vehicle_id=vehicle_id,
                          depots=accessible_depots,
-                         stock_items=stock_items,
+                         stock_items=summary['stock_items'],
                          current_time=datetime.now(UTC))
 
 def generate_stock_summary_pdf_data(depot_id=None, period='all', currency='GNF', start_date=None, end_date=None, stock_item_id=None, vehicle_id=None):
@@ -4277,200 +3520,41 @@ def generate_stock_summary_pdf_data(depot_id=None, period='all', currency='GNF',
     Fonction utilitaire pour générer les données du PDF de récapitulatif de stock
     Peut être utilisée par les rapports automatiques
     """
-    from datetime import datetime, UTC, timedelta
-    from sqlalchemy import func, and_, or_
-    from decimal import Decimal
-    
-    # Calculer les dates selon la période
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    period_start_date = None
-    period_end_date = None
-    
-    if period == 'today':
-        period_start_date = today
-        period_end_date = datetime.now(UTC)
-    elif period == 'week':
-        week_start = today - timedelta(days=today.weekday())
-        period_start_date = week_start
-        period_end_date = datetime.now(UTC)
-    elif period == 'month':
-        month_start = today.replace(day=1)
-        period_start_date = month_start
-        period_end_date = datetime.now(UTC)
-    elif period == 'year':
-        year_start = today.replace(month=1, day=1)
-        period_start_date = year_start
-        period_end_date = datetime.now(UTC)
-    elif period == 'custom' and start_date and end_date:
-        try:
-            if isinstance(start_date, str):
-                start = datetime.strptime(start_date, '%Y-%m-%d')
-            else:
-                start = start_date
-            if isinstance(end_date, str):
-                end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-            else:
-                end = end_date + timedelta(days=1)
-            period_start_date = start.replace(tzinfo=UTC) if start.tzinfo is None else start
-            period_end_date = end.replace(tzinfo=UTC) if end.tzinfo is None else end
-        except:
-            pass
-    
-    # Récupérer les données de stock
-    from utils_region_filter import filter_depots_by_region, filter_stock_movements_by_region
-    depots_query = Depot.query.filter_by(is_active=True)
-    depots_query = filter_depots_by_region(depots_query)
-    accessible_depots = depots_query.all()
-    
-    stock_items = StockItem.query.filter_by(is_active=True).order_by(StockItem.name).all()
+    summary = compute_stock_summary(
+        period=period, start_date=start_date, end_date=end_date,
+        depot_id=depot_id, vehicle_id=vehicle_id, stock_item_id=stock_item_id
+    )
     
-    # Préparer les données pour le PDF
     depot_name = 'Tous les dépôts'
     if depot_id:
-        depot = next((d for d in accessible_depots if d.id == depot_id), None)
+        depot = next((d for d in summary['depots'] if d.id == depot_id), None)
         if depot:
             depot_name = depot.name
     
-        stock_data = {
+    period_start_date = summary['period_start']
+    period_end_date = summary['period_end']
+    if period_start_date and not period_end_date:
+        period_end_date = datetime.now(UTC)
+    
+    stock_data = {
         'depot_name': depot_name,
         'period': period,
-        'start_date': period_start_date,
-        'end_date': period_end_date,
-            'items': []
-        }
-        
-    # Calculer les quantités restantes pour chaque article
-    for item in stock_items:
-        if stock_item_id and item.id != stock_item_id:
-            continue
-        
-        # Calculer le stock initial (avant la période)
-        initial_stock = Decimal('0')
-        if period_start_date:
-            if depot_id:
-                initial_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                    or_(
-                        StockMovement.to_depot_id == depot_id,
-                        StockMovement.from_depot_id == depot_id
-                    )
-                )
-                initial_movements_query = filter_stock_movements_by_region(initial_movements_query)
-                period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-                initial_movements_query = initial_movements_query.filter(StockMovement.movement_date < period_start_naive)
-                initial_movements = initial_movements_query.all()
-                
-                balance = Decimal('0')
-                for m in initial_movements:
-                    if m.to_depot_id == depot_id:
-                        balance += m.quantity
-                    elif m.from_depot_id == depot_id:
-                        balance -= abs(m.quantity)
-                initial_stock = balance
-            elif vehicle_id:
-                initial_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                    or_(
-                        StockMovement.to_vehicle_id == vehicle_id,
-                        StockMovement.from_vehicle_id == vehicle_id
-                    )
-                )
-                initial_movements_query = filter_stock_movements_by_region(initial_movements_query)
-                period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-                initial_movements_query = initial_movements_query.filter(StockMovement.movement_date < period_start_naive)
-                initial_movements = initial_movements_query.all()
-                
-                balance = Decimal('0')
-                for m in initial_movements:
-                    if m.to_vehicle_id == vehicle_id:
-                        balance += m.quantity
-                    elif m.from_vehicle_id == vehicle_id:
-                        balance -= abs(m.quantity)
-                initial_stock = balance
-            else:
-                initial_movements_query = StockMovement.query.filter_by(stock_item_id=item.id)
-                initial_movements_query = filter_stock_movements_by_region(initial_movements_query)
-                period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-                initial_movements_query = initial_movements_query.filter(StockMovement.movement_date < period_start_naive)
-                initial_movements = initial_movements_query.all()
-                for m in initial_movements:
-                    initial_stock += m.quantity
-        
-        # Calculer les mouvements dans la période
-        movements_query = StockMovement.query.filter_by(stock_item_id=item.id)
-        movements_query = filter_stock_movements_by_region(movements_query)
-        if period_start_date:
-            period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-            movements_query = movements_query.filter(StockMovement.movement_date >= period_start_naive)
-        if period_end_date:
-            period_end_naive = period_end_date.replace(tzinfo=None) if period_end_date.tzinfo else period_end_date
-            movements_query = movements_query.filter(StockMovement.movement_date <= period_end_naive)
-        if depot_id:
-            movements_query = movements_query.filter(
-                or_(
-                    StockMovement.from_depot_id == depot_id,
-                    StockMovement.to_depot_id == depot_id
-                )
-            )
-        if vehicle_id:
-            movements_query = movements_query.filter(
-                or_(
-                    StockMovement.from_vehicle_id == vehicle_id,
-                    StockMovement.to_vehicle_id == vehicle_id
-                )
-            )
-        
-        movements = movements_query.all()
-        entries = sum(float(m.quantity) for m in movements if float(m.quantity) > 0)
-        exits = sum(abs(float(m.quantity)) for m in movements if float(m.quantity) < 0)
-        final_stock_calculated = float(initial_stock) + entries - exits
-        
-        # Calculer le stock actuel (balance totale)
-        if depot_id:
-            depot_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                or_(
-                    StockMovement.to_depot_id == depot_id,
-                    StockMovement.from_depot_id == depot_id
-                )
-            )
-            depot_movements_query = filter_stock_movements_by_region(depot_movements_query)
-            depot_movements = depot_movements_query.all()
-            balance = Decimal('0')
-            for m in depot_movements:
-                if m.to_depot_id == depot_id:
-                    balance += m.quantity
-                elif m.from_depot_id == depot_id:
-                    balance -= abs(m.quantity)
-            current_stock = float(balance)
-        elif vehicle_id:
-            vehicle_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                or_(
-                    StockMovement.to_vehicle_id == vehicle_id,
-                    StockMovement.from_vehicle_id == vehicle_id
-                )
-            )
-            vehicle_movements_query = filter_stock_movements_by_region(vehicle_movements_query)
-            vehicle_movements = vehicle_movements_query.all()
-            balance = Decimal('0')
-            for m in vehicle_movements:
-                if m.to_vehicle_id == vehicle_id:
-                    balance += m.quantity
-                elif m.from_vehicle_id == vehicle_id:
-                    balance -= abs(m.quantity)
-            current_stock = float(balance)
-        else:
-            all_movements_query = StockMovement.query.filter_by(stock_item_id=item.id)
-            all_movements_query = filter_stock_movements_by_region(all_movements_query)
-            all_movements = all_movements_query.all()
-            current_stock = float(sum(m.quantity for m in all_movements))
-        
-        stock_data['items'].append({
-            'article_name': item.name,
-            'sku': item.sku or '',
-            'initial_stock': float(initial_stock),
-            'entries': entries,
-            'exits': exits,
-            'final_stock_calculated': final_stock_calculated,
-            'current_stock': current_stock,
-            'movements_count': len(movements)
+        'start_date': period_start_date.replace(tzinfo=UTC) if period_start_date else None,
+        'end_date': period_end_date.replace(tzinfo=UTC) if period_end_date and period_end_date.tzinfo is None else period_end_date,
+        'items': []
+    }
+    
+    for row in summary['rows']:
+        item = row['item']
+        stock_data['items'].append({
+            'article_name': item.name,
+            'sku': item.sku or '',
+            'initial_stock': row['initial_stock'],
+            'entries': row['entries'],
+            'exits': row['exits'],
+            'final_stock_calculated': row['final_stock_calculated'],
+            'current_stock': row['current_stock'],
+            'movements_count': row['movements_count']
         })
     
     return stock_data
@@ -4559,15 +3643,13 @@ def stock_summary_pdf():
         send_notification = request.args.get('send_notification', 'false').lower() == 'true'
         if send_notification:
             try:
-                from notifications_automatiques import notifications_automatiques
-                notifications_automatiques.notifier_situation_stock_periode(
-                    depot_id=depot_id,
-                    period=period,
-                    recipients=None  # Utilisera les superviseurs par défaut
-                )
-                flash('PDF généré et notification envoyée avec succès', 'success')
+                # Envoi WhatsApp hors requête (superviseurs par défaut)
+                job_queue.enqueue('notifications.situation_stock', {'depot_id': depot_id, 'period': period})
+                db.session.commit()
+                flash('PDF généré, envoi de la notification programmé', 'success')
             except Exception as e:
-                print(f"⚠️ Erreur lors de l'envoi de notification: {e}")
+                db.session.rollback()
+                print(f"⚠️ Erreur lors de la programmation de la notification: {e}")
         
         # Retourner le PDF
         filename = f'stock_summary_{datetime.now(UTC).strftime("%Y%m%d_%H%M%S")}.pdf'
@@ -4624,70 +3706,20 @@ def stock_summary_excel():
         stock_item_id = request.args.get('stock_item_id', type=int)
         depot_id = request.args.get('depot_id', type=int)
         
-        # Récupérer les données
-        stock_items = StockItem.query.filter_by(is_active=True).order_by(StockItem.name).all()
-        depots = Depot.query.filter_by(is_active=True).order_by(Depot.name).all()
-        
-        # Optimisation : Charger tous les stocks en une seule requête pour éviter N+1
-        stock_item_ids = [item.id for item in stock_items]
-        if stock_item_id:
-            stock_item_ids = [stock_item_id]
-        
-        # Charger tous les stocks de dépôt en une requête
-        if depot_id:
-            all_depot_stocks = DepotStock.query.filter(
-                DepotStock.stock_item_id.in_(stock_item_ids),
-                DepotStock.depot_id == depot_id
-            ).all()
-        else:
-            all_depot_stocks = DepotStock.query.filter(
-                DepotStock.stock_item_id.in_(stock_item_ids)
-            ).all()
-        
-        # Charger tous les stocks de véhicule en une requête
-        all_vehicle_stocks = VehicleStock.query.filter(
-            VehicleStock.stock_item_id.in_(stock_item_ids)
-        ).all() if not depot_id else []
-        
-        # Grouper par stock_item_id en mémoire
-        depot_stocks_by_item = {}
-        for ds in all_depot_stocks:
-            if ds.stock_item_id not in depot_stocks_by_item:
-                depot_stocks_by_item[ds.stock_item_id] = []
-            depot_stocks_by_item[ds.stock_item_id].append(ds)
-        
-        vehicle_stocks_by_item = {}
-        for vs in all_vehicle_stocks:
-            if vs.stock_item_id not in vehicle_stocks_by_item:
-                vehicle_stocks_by_item[vs.stock_item_id] = []
-            vehicle_stocks_by_item[vs.stock_item_id].append(vs)
+        # Soldes issus du grand livre (mêmes chiffres que la page récapitulative)
+        summary = compute_stock_summary(period=period, depot_id=depot_id, stock_item_id=stock_item_id)
         
         # Préparer les données pour Excel
         data = []
         depot_name = 'Tous les dépôts'
         if depot_id:
-            depot = Depot.query.get(depot_id)
+            depot = next((d for d in summary['depots'] if d.id == depot_id), None)
             if depot:
                 depot_name = depot.name
         
-        for item in stock_items:
-            if stock_item_id and item.id != stock_item_id:
-                continue
-            
-            # Calculer le stock total depuis les données groupées
-            total_stock = Decimal('0')
-            depot_stock = Decimal('0')
-            
-            if depot_id:
-                depot_stocks = depot_stocks_by_item.get(item.id, [])
-                depot_stock = sum(Decimal(str(ds.quantity)) for ds in depot_stocks)
-                total_stock = depot_stock
-            else:
-                depot_stocks = depot_stocks_by_item.get(item.id, [])
-                depot_stock = sum(Decimal(str(ds.quantity)) for ds in depot_stocks)
-                vehicle_stocks = vehicle_stocks_by_item.get(item.id, [])
-                vehicle_stock = sum(Decimal(str(vs.quantity)) for vs in vehicle_stocks)
-                total_stock = depot_stock + vehicle_stock
+        for row in summary['rows']:
+            item = row['item']
+            total_stock = row['depot_stock'] if depot_id else row['total_stock']
             
             if total_stock > 0:
                 value_gnf = float(total_stock) * float(item.purchase_price_gnf or 0)
@@ -4746,9 +3778,6 @@ def stock_summary_api():
     if not can_access_stocks(current_user):
         return jsonify({'error': 'Permission refusée'}), 403
     
-    from datetime import datetime, UTC, timedelta
-    from sqlalchemy import func, and_, or_
-    
     # Récupérer les paramètres de filtre
     period = request.args.get('period', 'all')
     start_date = request.args.get('start_date')
@@ -4757,117 +3786,28 @@ def stock_summary_api():
     vehicle_id = request.args.get('vehicle_id', type=int)
     stock_item_id = request.args.get('stock_item_id', type=int)
     
-    # Calculer les dates selon la période (même logique que stock_summary)
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    date_filter = None
-    
-    if period == 'today':
-        date_filter = and_(StockMovement.movement_date >= today)
-    elif period == 'week':
-        week_start = today - timedelta(days=today.weekday())
-        date_filter = and_(StockMovement.movement_date >= week_start)
-    elif period == 'month':
-        month_start = today.replace(day=1)
-        date_filter = and_(StockMovement.movement_date >= month_start)
-    elif period == 'year':
-        year_start = today.replace(month=1, day=1)
-        date_filter = and_(StockMovement.movement_date >= year_start)
-    elif period == 'custom' and start_date and end_date:
-        try:
-            start = datetime.strptime(start_date, '%Y-%m-%d')
-            end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-            date_filter = and_(StockMovement.movement_date >= start, StockMovement.movement_date < end)
-        except:
-            pass
-    
-    # Récupérer tous les articles de stock actifs
-    stock_items = StockItem.query.filter_by(is_active=True).order_by(StockItem.name).all()
+    # Même calcul que stock_summary (grand livre des soldes)
+    summary = compute_stock_summary(
+        period=period, start_date=start_date, end_date=end_date,
+        depot_id=depot_id, vehicle_id=vehicle_id, stock_item_id=stock_item_id
+    )
     
-    # Calculer le stock restant pour chaque article (même logique que stock_summary)
     stock_summary = []
-    for item in stock_items:
-        if stock_item_id and item.id != stock_item_id:
-            continue
-        
-        # Calculer la balance du stock à partir des mouvements (filtrés par région)
-        from utils_region_filter import filter_stock_movements_by_region
-        movements_query = StockMovement.query.filter_by(stock_item_id=item.id)
-        movements_query = filter_stock_movements_by_region(movements_query)
-        if date_filter is not None:
-            movements_query = movements_query.filter(date_filter)
-        movements = movements_query.all()
-        
-        # Balance par dépôt
-        depot_balances = {}
-        vehicle_balances = {}
-        total_stock = Decimal('0')
-        total_depot_stock = Decimal('0')
-        total_vehicle_stock = Decimal('0')
-        entries = Decimal('0')
-        exits = Decimal('0')
-        
-        for movement in movements:
-            qty = Decimal(str(movement.quantity))
-            
-            # Entrées : réceptions et mouvements positifs
-            if movement.movement_type == 'reception':
-                entries += abs(qty)
-            elif movement.movement_type in ['transfer', 'adjustment', 'inventory']:
-                if qty < 0:
-                    exits += abs(qty)  # Sorties : transferts sortants, ajustements négatifs
-                else:
-                    entries += qty  # Entrées : transferts entrants, ajustements positifs
-            elif movement.movement_type == 'reception_return':
-                # Retours fournisseurs : sorties (quantité négative)
-                exits += abs(qty)
-            
-            # Calculer par dépôt
-            if movement.to_depot_id:
-                depot_id_key = movement.to_depot_id
-                if depot_id_key not in depot_balances:
-                    depot_balances[depot_id_key] = Decimal('0')
-                depot_balances[depot_id_key] += qty
-                total_depot_stock += qty if qty > 0 else 0
-            
-            if movement.from_depot_id:
-                depot_id_key = movement.from_depot_id
-                if depot_id_key not in depot_balances:
-                    depot_balances[depot_id_key] = Decimal('0')
-                depot_balances[depot_id_key] -= abs(qty)
-            
-            # Calculer par véhicule
-            if movement.to_vehicle_id:
-                vehicle_id_key = movement.to_vehicle_id
-                if vehicle_id_key not in vehicle_balances:
-                    vehicle_balances[vehicle_id_key] = Decimal('0')
-                vehicle_balances[vehicle_id_key] += qty
-                total_vehicle_stock += qty if qty > 0 else 0
-            
-            if movement.from_vehicle_id:
-                vehicle_id_key = movement.from_vehicle_id
-                if vehicle_id_key not in vehicle_balances:
-                    vehicle_balances[vehicle_id_key] = Decimal('0')
-                vehicle_balances[vehicle_id_key] -= abs(qty)
-            
-            total_stock += qty
-        
-        # NOTE: Ne pas ajouter les stocks depuis DepotStock et VehicleStock ici
-        # car ils sont déjà calculés depuis les mouvements ci-dessus
-        # Cela éviterait le double comptage
-        # Les stocks DepotStock/VehicleStock sont des caches et doivent être cohérents avec les mouvements
-        
+    for row in summary['rows']:
+        item = row['item']
+        total_stock = row['total_stock']
         stock_summary.append({
             'item_id': item.id,
             'item_name': item.name,
             'item_sku': item.sku,
             'total_stock': float(total_stock),
-            'depot_stock': float(total_depot_stock),
-            'vehicle_stock': float(total_vehicle_stock),
-            'entries': float(entries),
-            'exits': float(exits),
-            'value': float(float(total_stock) * float(item.purchase_price_gnf) if total_stock > 0 else 0),
-            'depot_balances': {str(k): float(v) for k, v in depot_balances.items()},
-            'vehicle_balances': {str(k): float(v) for k, v in vehicle_balances.items()}
+            'depot_stock': float(row['depot_stock']),
+            'vehicle_stock': float(row['vehicle_stock']),
+            'entries': row['entries'],
+            'exits': row['exits'],
+            'value': float(total_stock * float(item.purchase_price_gnf) if total_stock > 0 and item.purchase_price_gnf else 0),
+            'depot_balances': {str(k): v for k, v in row['depot_balances'].items()},
+            'vehicle_balances': {str(k): v for k, v in row['vehicle_balances'].items()}
         })
     
     # Calculer les totaux
@@ -4875,84 +3815,25 @@ def stock_summary_api():
     total_quantity = sum(s['total_stock'] for s in stock_summary)
     total_value = sum(s['value'] for s in stock_summary)
     
-    # Calculer les statistiques par dépôt (similaire à stock_summary)
-    from utils_region_filter import filter_depots_by_region
-    depots_query = Depot.query.filter_by(is_active=True)
-    depots_query = filter_depots_by_region(depots_query)
-    depots = depots_query.order_by(Depot.name).all()
-    
+    # Statistiques par dépôt (transferts nets = entrants - sortants)
     depot_stats = []
-    total_receptions_all = Decimal('0')
-    total_entries_all = Decimal('0')
-    total_exits_all = Decimal('0')
-    total_transfers_all = Decimal('0')
-    
-    for depot in depots:
+    for stats in summary['depot_stats']:
+        depot = stats['depot']
         if depot_id and depot.id != depot_id:
             continue
-            
-        # Filtrer les mouvements pour ce dépôt (filtrés par région)
-        from utils_region_filter import filter_stock_movements_by_region
-        depot_movements_query = StockMovement.query.filter(
-            or_(
-                StockMovement.to_depot_id == depot.id,
-                StockMovement.from_depot_id == depot.id
-            )
-        )
-        depot_movements_query = filter_stock_movements_by_region(depot_movements_query)
-        
-        # Appliquer le filtre de date si spécifié
-        if date_filter is not None:
-            depot_movements_query = depot_movements_query.filter(date_filter)
-        
-        depot_movements = depot_movements_query.all()
-        
-        # Calculer les statistiques
-        total_receptions = Decimal('0')
-        total_exits = Decimal('0')
-        total_transfers_in = Decimal('0')
-        total_transfers_out = Decimal('0')
-        total_stock_depot = Decimal('0')
-        
-        for movement in depot_movements:
-            qty = Decimal(str(movement.quantity))
-            
-            if movement.movement_type == 'reception' and movement.to_depot_id == depot.id:
-                total_receptions += abs(qty)
-                total_stock_depot += abs(qty)
-            elif movement.movement_type == 'transfer':
-                if movement.to_depot_id == depot.id:
-                    total_transfers_in += abs(qty)
-                    total_stock_depot += abs(qty)
-                elif movement.from_depot_id == depot.id:
-                    total_transfers_out += abs(qty)
-                    total_stock_depot -= abs(qty)
-            elif qty < 0 and movement.from_depot_id == depot.id:
-                total_exits += abs(qty)
-                total_stock_depot -= abs(qty)
-        
-        # Ajouter les stocks depuis DepotStock (filtrés par région)
-        from utils_region_filter import filter_depot_stocks_by_region
-        depot_stocks_query = DepotStock.query.filter_by(depot_id=depot.id)
-        depot_stocks_query = filter_depot_stocks_by_region(depot_stocks_query)
-        depot_stocks = depot_stocks_query.all()
-        for ds in depot_stocks:
-            total_stock_depot += Decimal(str(ds.quantity))
-        
         depot_stats.append({
             'depot_id': depot.id,
             'depot_name': depot.name,
-            'total_receptions': float(total_receptions),
-            'total_exits': float(total_exits),
-            'total_transfers': float(total_transfers_in - total_transfers_out),
-            'total_stock': float(total_stock_depot),
-            'movements_count': len(depot_movements)
+            'total_receptions': stats['total_receptions'],
+            'total_exits': stats['total_exits'],
+            'total_transfers': stats['total_transfers_in'] - stats['total_transfers_out'],
+            'total_stock': stats['total_stock'],
+            'movements_count': stats['movements_count']
         })
-        
-        total_receptions_all += total_receptions
-        total_exits_all += total_exits
-        total_transfers_all += (total_transfers_in - total_transfers_out)
     
+    total_receptions_all = sum(s['total_receptions'] for s in depot_stats)
+    total_exits_all = sum(s['total_exits'] for s in depot_stats)
+    total_transfers_all = sum(s['total_transfers'] for s in depot_stats)
     total_stock_all_depots = sum(s['total_stock'] for s in depot_stats)
     
     # Récupérer les dernières opérations pour l'API aussi
@@ -5052,282 +3933,28 @@ def stock_summary():
     vehicle_id = request.args.get('vehicle_id', type=int)
     stock_item_id = request.args.get('stock_item_id', type=int)
     
-    # Calculer les dates selon la période
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    date_filter = None
-    period_start_date = None
-    period_end_date = None
-    
-    if period == 'today':
-        period_start_date = today
-        period_end_date = datetime.now(UTC)
-        date_filter = and_(StockMovement.movement_date >= today)
-    elif period == 'week':
-        week_start = today - timedelta(days=today.weekday())
-        period_start_date = week_start
-        period_end_date = datetime.now(UTC)
-        date_filter = and_(StockMovement.movement_date >= week_start)
-    elif period == 'month':
-        month_start = today.replace(day=1)
-        period_start_date = month_start
-        period_end_date = datetime.now(UTC)
-        date_filter = and_(StockMovement.movement_date >= month_start)
-    elif period == 'year':
-        year_start = today.replace(month=1, day=1)
-        period_start_date = year_start
-        period_end_date = datetime.now(UTC)
-        date_filter = and_(StockMovement.movement_date >= year_start)
-    elif period == 'custom' and start_date and end_date:
-        try:
-            start = datetime.strptime(start_date, '%Y-%m-%d')
-            end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-            period_start_date = start.replace(tzinfo=UTC) if start.tzinfo is None else start
-            period_end_date = end.replace(tzinfo=UTC) if end.tzinfo is None else end
-            date_filter = and_(StockMovement.movement_date >= start, StockMovement.movement_date < end)
-        except:
-            pass
-    
-    # Récupérer les dépôts et véhicules filtrés par région (pour les calculs)
-    from utils_region_filter import filter_depots_by_region, filter_vehicles_by_region, filter_stock_movements_by_region
-    depots_query = Depot.query.filter_by(is_active=True)
-    depots_query = filter_depots_by_region(depots_query)
-    accessible_depots = depots_query.all()
-    accessible_depot_ids = [d.id for d in accessible_depots]
-    
-    vehicles_query = Vehicle.query.filter_by(status='active')
-    vehicles_query = filter_vehicles_by_region(vehicles_query)
-    accessible_vehicles = vehicles_query.all()
-    accessible_vehicle_ids = [v.id for v in accessible_vehicles]
-    
-    # Récupérer tous les articles de stock actifs
-    stock_items = StockItem.query.filter_by(is_active=True).order_by(StockItem.name).all()
+    # Soldes, stock initial, entrées/sorties et statistiques par dépôt
+    # calculés en quelques requêtes agrégées sur le grand livre des soldes
+    from utils_region_filter import filter_stock_movements_by_region
+    summary = compute_stock_summary(
+        period=period, start_date=start_date, end_date=end_date,
+        depot_id=depot_id, vehicle_id=vehicle_id, stock_item_id=stock_item_id
+    )
+    stock_items = summary['stock_items']
     
-    # Calculer le stock restant pour chaque article
+    # N'afficher que les articles avec du stock restant (stock actuel > 0)
     stock_summary = []
-    for item in stock_items:
-        # Filtrer par article si spécifié
-        if stock_item_id and item.id != stock_item_id:
-            continue
-        
-        # Calculer la balance du stock à partir des mouvements (méthode recommandée)
-        # Balance = somme de tous les mouvements (entrées positives + sorties négatives)
-        
-        # Balance par dépôt
-        depot_balances = {}
-        if depot_id:
-            # Vérifier que l'utilisateur a accès à ce dépôt
-            if depot_id not in accessible_depot_ids:
-                continue  # Skip cet article si le dépôt n'est pas accessible
-            
-            # Balance pour un dépôt spécifique
-            depot_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                or_(
-                    StockMovement.to_depot_id == depot_id,
-                    StockMovement.from_depot_id == depot_id
-                )
-            )
-            depot_movements_query = filter_stock_movements_by_region(depot_movements_query)
-            depot_movements = depot_movements_query.all()
-            
-            # Calculer la balance : entrées (to_depot) - sorties (from_depot)
-            balance = Decimal('0')
-            for m in depot_movements:
-                if m.to_depot_id == depot_id:
-                    balance += m.quantity  # Entrée (positif)
-                elif m.from_depot_id == depot_id:
-                    # Sortie : forcer négatif pour garantir la cohérence
-                    balance -= abs(m.quantity)  # Sortie (soustraire la valeur absolue)
-            
-            depot_balances[depot_id] = float(balance)
-            total_depot_stock = float(balance)
-        else:
-            # Balance pour tous les dépôts accessibles
-            for depot in accessible_depots:
-                depot_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                    or_(
-                        StockMovement.to_depot_id == depot.id,
-                        StockMovement.from_depot_id == depot.id
-                    )
-                )
-                depot_movements_query = filter_stock_movements_by_region(depot_movements_query)
-                depot_movements = depot_movements_query.all()
-                
-                balance = Decimal('0')
-                for m in depot_movements:
-                    if m.to_depot_id == depot.id:
-                        balance += m.quantity  # Entrée
-                    elif m.from_depot_id == depot.id:
-                        # Sortie : forcer négatif pour garantir la cohérence
-                        balance -= abs(m.quantity)  # Sortie (soustraire la valeur absolue)
-                
-                depot_balances[depot.id] = float(balance)
-            
-            total_depot_stock = sum(depot_balances.values())
-        
-        # Balance par véhicule
-        vehicle_balances = {}
-        if vehicle_id:
-            # Vérifier que l'utilisateur a accès à ce véhicule
-            if vehicle_id not in accessible_vehicle_ids:
-                continue  # Skip cet article si le véhicule n'est pas accessible
-            
-            vehicle_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                or_(
-                    StockMovement.to_vehicle_id == vehicle_id,
-                    StockMovement.from_vehicle_id == vehicle_id
-                )
-            )
-            vehicle_movements_query = filter_stock_movements_by_region(vehicle_movements_query)
-            vehicle_movements = vehicle_movements_query.all()
-            
-            balance = Decimal('0')
-            for m in vehicle_movements:
-                if m.to_vehicle_id == vehicle_id:
-                    balance += m.quantity  # Entrée
-                elif m.from_vehicle_id == vehicle_id:
-                    # Sortie : forcer négatif pour garantir la cohérence
-                    balance -= abs(m.quantity)  # Sortie (soustraire la valeur absolue)
-            
-            vehicle_balances[vehicle_id] = float(balance)
-            total_vehicle_stock = float(balance)
-        else:
-            # Balance pour tous les véhicules accessibles
-            for vehicle in accessible_vehicles:
-                vehicle_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                    or_(
-                        StockMovement.to_vehicle_id == vehicle.id,
-                        StockMovement.from_vehicle_id == vehicle.id
-                    )
-                )
-                vehicle_movements_query = filter_stock_movements_by_region(vehicle_movements_query)
-                vehicle_movements = vehicle_movements_query.all()
-                
-                balance = Decimal('0')
-                for m in vehicle_movements:
-                    if m.to_vehicle_id == vehicle.id:
-                        balance += m.quantity  # Entrée
-                    elif m.from_vehicle_id == vehicle.id:
-                        # Sortie : forcer négatif pour garantir la cohérence
-                        balance -= abs(m.quantity)  # Sortie (soustraire la valeur absolue)
-                
-                vehicle_balances[vehicle.id] = float(balance)
-            
-            total_vehicle_stock = sum(vehicle_balances.values())
-        
-        # Stock total (balance globale)
-        total_stock = total_depot_stock + total_vehicle_stock
-        
-        # Mouvements dans la période (filtrés par région)
-        movements_query = StockMovement.query.filter_by(stock_item_id=item.id)
-        movements_query = filter_stock_movements_by_region(movements_query)
-        if date_filter is not None:
-            movements_query = movements_query.filter(date_filter)
-        if depot_id:
-            movements_query = movements_query.filter(
-                or_(
-                    StockMovement.from_depot_id == depot_id,
-                    StockMovement.to_depot_id == depot_id
-                )
-            )
-        if vehicle_id:
-            movements_query = movements_query.filter(
-                or_(
-                    StockMovement.from_vehicle_id == vehicle_id,
-                    StockMovement.to_vehicle_id == vehicle_id
-                )
-            )
-        
-        movements = movements_query.order_by(StockMovement.movement_date.desc()).all()
-        
-        # Calculer les entrées et sorties dans la période
-        # Entrées = quantités positives
-        entries = sum(float(m.quantity) for m in movements if float(m.quantity) > 0)
-        # Sorties = quantités négatives (on prend la valeur absolue pour l'affichage)
-        exits = sum(abs(float(m.quantity)) for m in movements if float(m.quantity) < 0)
-        
-        # Calculer le stock initial (avant la période sélectionnée)
-        initial_stock = Decimal('0')
-        if period_start_date:
-            # Stock initial = balance calculée jusqu'à period_start_date
-            # Utiliser la même logique que pour le stock total mais limitée aux mouvements avant la période
-            if depot_id:
-                # Balance initiale pour un dépôt spécifique
-                initial_depot_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                    or_(
-                        StockMovement.to_depot_id == depot_id,
-                        StockMovement.from_depot_id == depot_id
-                    )
-                )
-                initial_depot_movements_query = filter_stock_movements_by_region(initial_depot_movements_query)
-                period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-                initial_depot_movements_query = initial_depot_movements_query.filter(StockMovement.movement_date < period_start_naive)
-                initial_depot_movements = initial_depot_movements_query.all()
-                
-                balance = Decimal('0')
-                for m in initial_depot_movements:
-                    if m.to_depot_id == depot_id:
-                        balance += m.quantity  # Entrée
-                    elif m.from_depot_id == depot_id:
-                        balance -= abs(m.quantity)  # Sortie
-                initial_stock = balance
-            elif vehicle_id:
-                # Balance initiale pour un véhicule spécifique
-                initial_vehicle_movements_query = StockMovement.query.filter_by(stock_item_id=item.id).filter(
-                    or_(
-                        StockMovement.to_vehicle_id == vehicle_id,
-                        StockMovement.from_vehicle_id == vehicle_id
-                    )
-                )
-                initial_vehicle_movements_query = filter_stock_movements_by_region(initial_vehicle_movements_query)
-                period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-                initial_vehicle_movements_query = initial_vehicle_movements_query.filter(StockMovement.movement_date < period_start_naive)
-                initial_vehicle_movements = initial_vehicle_movements_query.all()
-                
-                balance = Decimal('0')
-                for m in initial_vehicle_movements:
-                    if m.to_vehicle_id == vehicle_id:
-                        balance += m.quantity  # Entrée
-                    elif m.from_vehicle_id == vehicle_id:
-                        balance -= abs(m.quantity)  # Sortie
-                initial_stock = balance
-            else:
-                # Balance initiale pour tous les dépôts et véhicules accessibles
-                initial_all_movements_query = StockMovement.query.filter_by(stock_item_id=item.id)
-                initial_all_movements_query = filter_stock_movements_by_region(initial_all_movements_query)
-                period_start_naive = period_start_date.replace(tzinfo=None) if period_start_date.tzinfo else period_start_date
-                initial_all_movements_query = initial_all_movements_query.filter(StockMovement.movement_date < period_start_naive)
-                initial_all_movements = initial_all_movements_query.all()
-                
-                # Calculer la balance globale initiale
-                for m in initial_all_movements:
-                    initial_stock += m.quantity
-        else:
-            # Si pas de période, le stock initial est 0
-            initial_stock = Decimal('0')
-        
-        # Stock final calculé = stock initial + entrées - sorties
-        final_stock_calculated = float(initial_stock) + entries - exits
-        
-        # N'afficher que les articles avec du stock restant (stock actuel > 0)
+    for row in summary['rows']:
+        total_stock = row['total_stock']
         if total_stock > 0:
-            stock_summary.append({
-                'item': item,
-                'total_stock': total_stock,
-                'depot_stock': total_depot_stock,
-                'vehicle_stock': total_vehicle_stock,
-                'depot_balances': depot_balances,  # Balance par dépôt
-                'vehicle_balances': vehicle_balances,  # Balance par véhicule
-                'entries': entries,
-                'exits': exits,
-                'movements_count': len(movements),
-                'value': (total_stock * float(item.purchase_price_gnf) if total_stock > 0 and item.purchase_price_gnf else 0),
-                'initial_stock': float(initial_stock),
-                'final_stock_calculated': final_stock_calculated
-            })
-    
-    # Utiliser les dépôts et véhicules déjà filtrés par région pour les filtres
-    depots = sorted(accessible_depots, key=lambda d: d.name)
-    vehicles = sorted(accessible_vehicles, key=lambda v: v.plate_number)
+            item = row['item']
+            row = dict(row)
+            row['value'] = total_stock * float(item.purchase_price_gnf) if item.purchase_price_gnf else 0
+            stock_summary.append(row)
+    
+    # Dépôts et véhicules déjà filtrés par région et triés pour les filtres
+    depots = summary['depots']
+    vehicles = summary['vehicles']
     
     # Calculer les totaux
     total_items = len(stock_summary)
@@ -5342,94 +3969,8 @@ def stock_summary():
     if can_view_values:
         total_value = sum(s['value'] for s in stock_summary)
     
-    # Calculer les statistiques par dépôt (entrées, sorties, transferts)
-    depot_stats = []
-    for depot in depots:
-        # Filtrer les mouvements pour ce dépôt (avec filtrage par région)
-        depot_movements_query = StockMovement.query.filter(
-            or_(
-                StockMovement.to_depot_id == depot.id,
-                StockMovement.from_depot_id == depot.id
-            )
-        )
-        depot_movements_query = filter_stock_movements_by_region(depot_movements_query)
-        
-        # Appliquer le filtre de date si spécifié
-        if date_filter is not None:
-            depot_movements_query = depot_movements_query.filter(date_filter)
-        
-        depot_movements = depot_movements_query.all()
-        
-        # Calculer les statistiques
-        total_receptions = Decimal('0')  # Réceptions (entrées externes)
-        total_exits = Decimal('0')    # Sorties (quantités négatives depuis ce dépôt)
-        total_transfers_in = Decimal('0')  # Transferts entrants (depuis un autre dépôt)
-        total_transfers_out = Decimal('0')  # Transferts sortants (vers un autre dépôt)
-        total_stock_depot = Decimal('0')  # Stock total du dépôt
-        
-        for movement in depot_movements:
-            qty = movement.quantity
-            
-            # Si c'est une entrée dans ce dépôt
-            if movement.to_depot_id == depot.id:
-                if qty > 0:
-                    # Distinguer les réceptions des transferts
-                    if movement.movement_type == 'reception':
-                        # Réception = entrée externe (pas de from_depot_id)
-                        total_receptions += qty
-                    elif movement.movement_type == 'transfer' and movement.from_depot_id is not None:
-                        # Transfert depuis un autre dépôt
-                        total_transfers_in += qty
-                    else:
-                        # Autres types d'entrées (ajustements positifs, retours, etc.)
-                        total_receptions += qty
-                total_stock_depot += qty
-            
-            # Si c'est une sortie de ce dépôt
-            elif movement.from_depot_id == depot.id:
-                if qty < 0:
-                    # Sorties : ventes, transferts sortants, ajustements négatifs, retours fournisseurs
-                    total_exits += abs(qty)
-                    # Si c'est un transfert vers un autre dépôt
-                    if movement.movement_type == 'transfer' and movement.to_depot_id is not None:
-                        total_transfers_out += abs(qty)
-                    # Si c'est un retour fournisseur
-                    elif movement.movement_type == 'reception_return':
-                        # Retour fournisseur = sortie (déjà compté dans total_exits)
-                        pass
-                total_stock_depot += qty
-        
-        # Total des entrées = réceptions + transferts entrants
-        total_entries = total_receptions + total_transfers_in
-        
-        # Calculer le stock total du dépôt (tous les articles, toutes périodes) avec filtrage par région
-        all_depot_movements_query = StockMovement.query.filter(
-            or_(
-                StockMovement.to_depot_id == depot.id,
-                StockMovement.from_depot_id == depot.id
-            )
-        )
-        all_depot_movements_query = filter_stock_movements_by_region(all_depot_movements_query)
-        all_depot_movements = all_depot_movements_query.all()
-        
-        depot_total_stock = Decimal('0')
-        for m in all_depot_movements:
-            if m.to_depot_id == depot.id:
-                depot_total_stock += m.quantity
-            elif m.from_depot_id == depot.id:
-                depot_total_stock += m.quantity
-        
-        depot_stats.append({
-            'depot': depot,
-            'total_receptions': float(total_receptions),
-            'total_entries': float(total_entries),
-            'total_exits': float(total_exits),
-            'total_transfers_in': float(total_transfers_in),
-            'total_transfers_out': float(total_transfers_out),
-            'total_transfers': float(total_transfers_in + total_transfers_out),
-            'total_stock': float(depot_total_stock),
-            'movements_count': len(depot_movements)
-        })
+    # Statistiques par dépôt (entrées, sorties, transferts)
+    depot_stats = summary['depot_stats']
     
     # Calculer les totaux globaux par dépôt
     total_receptions_all = sum(s['total_receptions'] for s in depot_stats)
@@ -6519,97 +5060,24 @@ def loading_execute(id):
         db.session.rollback()
         return redirect(url_for('stocks.loading_summary_detail', id=id))
     
-    # Vérifier le stock disponible dans le dépôt source
-    errors = []
-    for item in summary.items:
-        if item.id not in quantities_loaded:
-            continue
-        
-        qty_to_load = quantities_loaded[item.id]
-        source_stock = DepotStock.query.filter_by(
-            depot_id=summary.source_depot_id,
-            stock_item_id=item.stock_item_id
-        ).first()
-        
-        available_qty = source_stock.quantity if source_stock else Decimal('0')
-        print(f"DEBUG loading_execute: Item {item.stock_item.name} - Stock disponible: {available_qty}, Quantité à charger: {qty_to_load}")
-        if available_qty < qty_to_load:
-            error_msg = f'Stock insuffisant pour {item.stock_item.name} (disponible: {available_qty}, requis: {qty_to_load})'
-            errors.append(error_msg)
-            print(f"DEBUG loading_execute: ERREUR - {error_msg}")
-    
-    if errors:
-        print(f"DEBUG loading_execute: Erreurs détectées: {errors}")
-        flash('Erreurs de stock: ' + '; '.join(errors), 'error')
-        db.session.rollback()
-        return redirect(url_for('stocks.loading_summary_detail', id=id))
-    
-    print("DEBUG loading_execute: Vérification du stock OK, création des transferts...")
-    
     # Créer les transferts de stock
     loading_date = datetime.now(UTC)
-    generated_references = []  # Pour éviter les doublons dans la même transaction
+    loaded_items = [item for item in summary.items if item.id in quantities_loaded]
+    # Un seul bon de transfert pour tout le chargement
+    base_reference = reference_sequences.next_reference(MOVEMENT_REFERENCE_PREFIXES['transfer'])
+    reason_text = f'Chargement commande {summary.order.reference} - Commercial: {summary.commercial.full_name or summary.commercial.username}'
     
-    for item in summary.items:
-        if item.id not in quantities_loaded:
-            continue
-        
+    movement_rows = []
+    for line_number, item in enumerate(loaded_items, start=1):
         qty_to_load = quantities_loaded[item.id]
         
-        # Décrémenter le stock source
-        source_stock = DepotStock.query.filter_by(
-            depot_id=summary.source_depot_id,
-            stock_item_id=item.stock_item_id
-        ).first()
-        if not source_stock:
-            source_stock = DepotStock(depot_id=summary.source_depot_id, stock_item_id=item.stock_item_id, quantity=Decimal('0'))
-            db.session.add(source_stock)
-        source_stock.quantity -= qty_to_load
-        
-        # Incrémenter le stock destination
-        if summary.commercial_depot_id:
-            dest_stock = DepotStock.query.filter_by(
-                depot_id=summary.commercial_depot_id,
-                stock_item_id=item.stock_item_id
-            ).first()
-            if not dest_stock:
-                dest_stock = DepotStock(depot_id=summary.commercial_depot_id, stock_item_id=item.stock_item_id, quantity=Decimal('0'))
-                db.session.add(dest_stock)
-            dest_stock.quantity += qty_to_load
-        elif summary.commercial_vehicle_id:
-            dest_stock = VehicleStock.query.filter_by(
-                vehicle_id=summary.commercial_vehicle_id,
-                stock_item_id=item.stock_item_id
-            ).first()
-            if not dest_stock:
-                dest_stock = VehicleStock(vehicle_id=summary.commercial_vehicle_id, stock_item_id=item.stock_item_id, quantity=Decimal('0'))
-                db.session.add(dest_stock)
-            dest_stock.quantity += qty_to_load
-        
         # LOGIQUE MÉTIER : TRANSFERT = Déplacement entre dépôts/véhicules
         # Créer DEUX mouvements : SORTIE (négatif) depuis la source + ENTRÉE (positif) vers la destination
-        base_reference = generate_movement_reference('transfer', generated_references)
-        generated_references.append(base_reference)
-        
-        # Générer des références uniques pour chaque mouvement
-        reference_out = f"{base_reference}-OUT"
-        reference_in = f"{base_reference}-IN"
-        
-        # Vérifier et ajuster si nécessaire pour éviter les doublons
-        counter = 1
-        while StockMovement.query.filter_by(reference=reference_out).first():
-            reference_out = f"{base_reference}-OUT-{counter}"
-            counter += 1
-        
-        counter = 1
-        while StockMovement.query.filter_by(reference=reference_in).first():
-            reference_in = f"{base_reference}-IN-{counter}"
-            counter += 1
-        
-        reason_text = f'Chargement commande {summary.order.reference} - Commercial: {summary.commercial.full_name or summary.commercial.username}'
+        reference_out = movement_batches.line_reference(base_reference, 'OUT', line_number)
+        reference_in = movement_batches.line_reference(base_reference, 'IN', line_number)
         
         # Mouvement SORTIE (source)
-        movement_out = StockMovement(
+        movement_rows.append(dict(
             reference=reference_out,
             movement_type='transfer',
             movement_date=loading_date,
@@ -6617,32 +5085,35 @@ def loading_execute(id):
             quantity=-qty_to_load,  # NÉGATIF pour sortie
             user_id=current_user.id,
             from_depot_id=summary.source_depot_id,
-            from_vehicle_id=None,
-            to_depot_id=None,
-            to_vehicle_id=None,
             reason=f'{reason_text} - Sortie'
-        )
-        db.session.add(movement_out)
+        ))
         
         # Mouvement ENTRÉE (destination)
-        movement_in = StockMovement(
+        movement_rows.append(dict(
             reference=reference_in,
             movement_type='transfer',
             movement_date=loading_date,
             stock_item_id=item.stock_item_id,
             quantity=qty_to_load,  # POSITIF pour entrée
             user_id=current_user.id,
-            from_depot_id=None,
-            from_vehicle_id=None,
             to_depot_id=summary.commercial_depot_id,
             to_vehicle_id=summary.commercial_vehicle_id,
             reason=f'{reason_text} - Entrée'
-        )
-        db.session.add(movement_in)
+        ))
         
         # Mettre à jour l'item du récapitulatif
         item.quantity_loaded = qty_to_load
-        print(f"DEBUG loading_execute: Mouvements créés pour item {item.stock_item.name} - Sortie: {reference_out}, Entrée: {reference_in}")
+        print(f"DEBUG loading_execute: Mouvements préparés pour item {item.stock_item.name} - Sortie: {reference_out}, Entrée: {reference_in}")
+    
+    # Stock source vérifié et décrémenté dans la même instruction que l'écriture (pas de lecture préalable)
+    try:
+        stock_mutations.record_movements(movement_rows)
+    except stock_mutations.InsufficientStockError as e:
+        errors = insufficient_stock_messages(e)
+        print(f"DEBUG loading_execute: Erreurs détectées: {errors}")
+        db.session.rollback()
+        flash('Erreurs de stock: ' + '; '.join(errors), 'error')
+        return redirect(url_for('stocks.loading_summary_detail', id=id))
     
     print("DEBUG loading_execute: Tous les mouvements créés, flush de la session...")
     db.session.flush()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests des séries temporelles analytiques (analytics_series)
+"""
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+from models import db, Category, Article, Simulation, SimulationItem
+import analytics_series
+import landed_cost
+
+
+@pytest.fixture
+def app(app):
+    analytics_series._store.local.clear()
+    db.session.add(Category(id=1, name='Catégorie'))
+    db.session.add_all([
+        Article(id=1, name='Article 1', category_id=1, purchase_price=Decimal('10'), purchase_currency='USD'),
+        Article(id=2, name='Article 2', category_id=1, purchase_price=Decimal('5'), purchase_currency='EUR'),
+    ])
+    db.session.commit()
+    yield app
+    analytics_series._store.local.clear()
+
+
+def _add_simulation(sim_id, created_at, completed, items):
+    db.session.add(Simulation(id=sim_id, rate_usd=Decimal('8000'), rate_eur=Decimal('9000'),
+                              is_completed=completed, created_at=created_at))
+    for item_id, (article_id, currency, price, quantity, selling) in enumerate(items, start=sim_id * 10):
+        db.session.add(SimulationItem(id=item_id, simulation_id=sim_id, article_id=article_id,
+                                      purchase_currency=currency, purchase_price=Decimal(price),
+                                      quantity=Decimal(quantity), selling_price_gnf=Decimal(selling)))
+    db.session.commit()
+
+
+def test_daily_series_in_one_query(app):
+    today = date.today()
+    yesterday = datetime.combine(today - timedelta(days=1), datetime.min.time()) + timedelta(hours=10)
+    _add_simulation(1, yesterday, True, [(1, 'USD', '10', '2', '100000'), (2, 'EUR', '5', '1', '50000')])
+    _add_simulation(2, yesterday, False, [(1, 'USD', '10', '1', '100000')])
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        result = analytics_series.simulation_series(today - timedelta(days=6), today, 'day',
+                                                    ['revenue', 'margin', 'simulations'])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert len(statements) == 1
+    assert len(result['labels']) == 7
+    # Seule la simulation terminée compte dans le chiffre d'affaires
+    assert result['series']['revenue'][5] == 250000
+    assert result['series']['margin'][5] == 250000 - (10 * 8000 * 2 + 5 * 9000)
+    assert result['series']['simulations'][5] == 2
+    assert sum(result['series']['revenue']) == 250000
+
+
+def test_closed_buckets_are_cached_until_simulations_change(app):
+    today = date.today()
+    start = today - timedelta(days=13)
+    analytics_series.simulation_series(start, today, 'week', ['revenue'])
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        # La semaine clôturée vient du cache : la requête ne porte que sur la semaine en cours
+        analytics_series.simulation_series(start, today, 'week', ['revenue'])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert len(statements) == 1
+
+    old_day = datetime.combine(start, datetime.min.time()) + timedelta(hours=9)
+    _add_simulation(3, old_day, True, [(1, 'USD', '1', '1', '20000')])
+    result = analytics_series.simulation_series(start, today, 'week', ['revenue'])
+    assert result['series']['revenue'] == [20000, 0]
+
+
+def test_purchase_conversion_matches_landed_cost(app):
+    # XOF sans taux et devise non gérée : taux USD, comme le moteur landed_cost et les KPIs
+    today = date.today()
+    created = datetime.combine(today, datetime.min.time()) + timedelta(hours=8)
+    _add_simulation(4, created, True, [(1, 'XOF', '300', '2', '90000'), (2, 'GNF', '7', '3', '40000')])
+
+    result = analytics_series.simulation_series(today, today, 'day', ['purchase'])
+    simulation = db.session.get(Simulation, 4)
+    expected = landed_cost.landed_costs(simulation, simulation.items).total_purchase_value
+    assert result['series']['purchase'] == [float(expected)] and expected == 300 * 8000 * 2 + 7 * 8000 * 3
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests des KPIs de stock ensemblistes (analytics.compute_stock_kpis)
+"""
+
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+from models import db, StockItem, DepotStock, VehicleStock, StockMovement
+import analytics
+
+
+@pytest.fixture
+def app(app, seed):
+    seed.region(1, 'Conakry')
+    seed.region(2, 'Kindia')
+    seed.role()
+    seed.family()
+    seed.user(username='u1', role_id=1, region_id=1)
+    seed.depot(1, 'Dépôt CKY', region_id=1)
+    seed.depot(2, 'Dépôt KND', region_id=2)
+    seed.vehicle(current_user_id=1)
+    db.session.add_all([
+        StockItem(id=1, sku='SKU-1', name='Article 1', family_id=1, purchase_price_gnf=Decimal('1000'),
+                  min_stock_depot=Decimal('50'), min_stock_vehicle=Decimal('5')),
+        StockItem(id=2, sku='SKU-2', name='Article 2', family_id=1, purchase_price_gnf=Decimal('200'),
+                  min_stock_depot=Decimal('0'), min_stock_vehicle=Decimal('0')),
+    ])
+    db.session.add_all([
+        DepotStock(id=1, depot_id=1, stock_item_id=1, quantity=Decimal('20')),   # sous le seuil (50)
+        DepotStock(id=2, depot_id=2, stock_item_id=2, quantity=Decimal('100')),
+        VehicleStock(id=1, vehicle_id=1, stock_item_id=1, quantity=Decimal('10')),  # au-dessus du seuil (5)
+    ])
+    now = datetime.now()
+    db.session.add_all([
+        StockMovement(id=1, movement_type='reception', stock_item_id=1, quantity=Decimal('30'),
+                      movement_date=now, to_depot_id=1),
+        StockMovement(id=2, movement_type='transfer', stock_item_id=1, quantity=Decimal('-10'),
+                      movement_date=now, from_depot_id=1),
+        StockMovement(id=3, movement_type='reception', stock_item_id=2, quantity=Decimal('100'),
+                      movement_date=now, to_depot_id=2),
+        StockMovement(id=4, movement_type='reception', stock_item_id=2, quantity=Decimal('7'),
+                      movement_date=now - timedelta(days=90), to_depot_id=2),
+    ])
+    db.session.commit()
+    return app
+
+
+def test_global_kpis(app):
+    start = date.today() - timedelta(days=7)
+    kpis = analytics.compute_stock_kpis(start, datetime.now() + timedelta(days=1))
+    assert kpis['total_quantity'] == 130
+    assert kpis['total_value'] == 20 * 1000 + 100 * 200 + 10 * 1000
+    assert kpis['entries'] == 130
+    assert kpis['exits'] == 10
+    assert kpis['low_stock_items_count'] == 1
+    assert kpis['low_stock_items'][0]['sku'] == 'SKU-1'
+    assert kpis['low_stock_items'][0]['shortfall'] == 30
+
+
+def test_region_scope_and_constant_queries(app):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        kpis = analytics.compute_stock_kpis(region_id=2)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert kpis['total_quantity'] == 100
+    assert kpis['entries'] == 107
+    assert kpis['exits'] == 0
+    assert kpis['low_stock_items_count'] == 0
+    # Nombre de requêtes indépendant du volume de stocks et de mouvements
+    assert len(statements) == 5
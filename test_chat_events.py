@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du bus d'événements du chat (backend en mémoire) et de la durée des streams SSE
+"""
+
+import threading
+import time
+
+from chat import events, sse
+
+
+def test_room_subscription_receives_only_its_room():
+    bus = events.InMemoryEventBus()
+    events.set_event_bus(bus)
+    try:
+        with events.subscribe(room_id=1) as sub_room_1, events.subscribe(room_id=2) as sub_room_2:
+            events.publish(events.EVENT_NEW_MESSAGE, 1, recipient_ids=[10, 11], id=5, content='Bonjour')
+
+            event = sub_room_1.get(timeout=1)
+            assert event['type'] == 'new_message'
+            assert event['id'] == 5
+            assert sub_room_2.get(timeout=0.05) is None
+        assert bus.subscriber_count() == 0
+    finally:
+        events.set_event_bus(None)
+
+
+def test_user_subscription_filters_on_recipients():
+    bus = events.InMemoryEventBus()
+    events.set_event_bus(bus)
+    try:
+        with events.subscribe(user_id=11) as sub:
+            events.publish_room_read(3, 12)
+            events.publish(events.EVENT_NEW_MESSAGE, 3, recipient_ids=[11, 12], id=7)
+            assert sub.get(timeout=1)['id'] == 7
+            assert sub.get(timeout=0.05) is None
+    finally:
+        events.set_event_bus(None)
+
+
+def test_blocked_subscriber_wakes_on_publish():
+    bus = events.InMemoryEventBus()
+    events.set_event_bus(bus)
+    try:
+        received = []
+        with events.subscribe(room_id=1) as sub:
+            waiter = threading.Thread(target=lambda: received.append(sub.get(timeout=5)))
+            waiter.start()
+            events.publish(events.EVENT_MESSAGE_DELETED, 1, id=9, content='[Message supprimé]')
+            waiter.join(timeout=5)
+        assert received and received[0]['type'] == 'message_deleted'
+    finally:
+        events.set_event_bus(None)
+
+
+def test_tls_redis_url_selects_the_redis_bus(monkeypatch):
+    # rediss:// (Redis managé en TLS) active le bus Redis comme redis://
+    monkeypatch.setenv('REDIS_URL', 'rediss://cache.example.com:6380/0')
+    monkeypatch.setattr(events, 'RedisEventBus', lambda redis_url: ('redis', redis_url))
+    events.set_event_bus(None)
+    try:
+        assert events.get_event_bus() == ('redis', 'rediss://cache.example.com:6380/0')
+    finally:
+        events.set_event_bus(None)
+
+
+def test_sse_stream_ends_before_the_worker_timeout(monkeypatch):
+    # Le générateur se termine après STREAM_MAX_DURATION : le worker est libéré, le client se reconnecte
+    monkeypatch.setattr(sse, 'STREAM_MAX_DURATION', 0.3)
+    monkeypatch.setattr(sse, 'HEARTBEAT_INTERVAL', 0.1)
+    events.set_event_bus(events.InMemoryEventBus())
+    try:
+        with events.subscribe(room_id=1) as sub:
+            events.publish(events.EVENT_NEW_MESSAGE, 1, id=3)
+            started = time.monotonic()
+            received = list(sse._stream_events(sub))
+        assert time.monotonic() - started < 1
+        assert received[0]['id'] == 3 and received[1:] and all(event is None for event in received[1:])
+    finally:
+        events.set_event_bus(None)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test de la page d'accueil (GET /) : statistiques du moteur dashboard_stats et
+listes récentes, sans repli sur les compteurs à zéro ; marges des simulations
+(accueil et liste) calculées par le moteur landed_cost
+Application complète (module app) sur sa propre base temporaire, hors fixture commune
+"""
+
+import os
+import sys
+import tempfile
+
+from decimal import Decimal
+
+import pytest
+
+if 'app' in sys.modules:
+    pytest.skip("application déjà importée avec une autre base", allow_module_level=True)
+
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'index.db')}"
+os.environ.setdefault('JOB_QUEUE_EMBEDDED_WORKER', '0')
+os.environ.setdefault('DISABLE_SCHEDULER', '1')
+
+import app as application  # noqa: E402
+import dashboard_stats  # noqa: E402
+import landed_cost  # noqa: E402
+from models import (  # noqa: E402
+    db, Role, User, Region, Depot, Family, StockItem, StockMovement, Category, Article, Simulation, SimulationItem
+)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    flask_app = application.app
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    dashboard_stats._store.local.clear()
+    with flask_app.app_context():
+        admin_role = Role.query.filter_by(code='admin').first()
+        if admin_role is None:
+            admin_role = Role(id=9001, name='Administrateur', code='admin', permissions={})
+            db.session.add(admin_role)
+        db.session.add_all([Region(id=9001, name='Région test'), Family(id=9001, name='Famille test'),
+                            Category(id=9001, name='Catégorie test')])
+        db.session.flush()
+        db.session.add_all([
+            User(id=9001, username='index-admin', email='index@example.com', password_hash='x',
+                 role_id=admin_role.id, is_active=True),
+            Depot(id=9001, name='Dépôt test A', region_id=9001, is_active=True),
+            Depot(id=9002, name='Dépôt test B', region_id=9001, is_active=True),
+            StockItem(id=9001, sku='SKU-INDEX', name='Article index', family_id=9001),
+            Article(id=9001, name='Article simulation', category_id=9001),
+            Article(id=9002, name='Article simulation 2', category_id=9001),
+            # XOF sans taux : converti au taux USD par le moteur
+            Simulation(id=9001, rate_usd=Decimal('8600'), rate_eur=Decimal('9400'), rate_xof=Decimal('0'),
+                       customs_gnf=Decimal('500000'), transport_per_kg_gnf=Decimal('100')),
+        ])
+        db.session.flush()
+        db.session.add_all([
+            SimulationItem(id=9001, simulation_id=9001, article_id=9001, quantity=Decimal('10'),
+                           purchase_price=Decimal('20'), purchase_currency='XOF', unit_weight_kg=Decimal('2'),
+                           selling_price_gnf=Decimal('250000')),
+            SimulationItem(id=9002, simulation_id=9001, article_id=9002, quantity=Decimal('4'),
+                           purchase_price=Decimal('15'), purchase_currency='EUR', unit_weight_kg=Decimal('1'),
+                           selling_price_gnf=Decimal('180000')),
+        ])
+        db.session.add(StockMovement(id=9001, movement_type='reception', stock_item_id=9001, quantity=1,
+                                     user_id=9001, to_depot_id=9001))
+        db.session.commit()
+
+    rendered = {}
+
+    def capture(template, **context):
+        rendered.update(context, template=template)
+        return 'ok'
+
+    monkeypatch.setattr(application, 'render_template', capture)
+    with flask_app.test_client() as client:
+        with client.session_transaction() as session:
+            session['_user_id'] = '9001'
+            session['_fresh'] = True
+        yield client, rendered
+
+    with flask_app.app_context():
+        for model in (SimulationItem, Simulation, Article, Category, StockMovement, StockItem, Depot, User,
+                      Family, Region, Role):
+            model.query.filter(model.id >= 9001).delete()
+        db.session.commit()
+    dashboard_stats._store.local.clear()
+
+
+def test_index_renders_dashboard_counters(client):
+    client, rendered = client
+    assert client.get('/').status_code == 200
+
+    counts = rendered['counts']
+    assert counts['depots_count'] >= 2 and counts['regions_count'] >= 1
+    assert counts['stock_items_count'] >= 1 and counts['movements_count'] >= 1
+    assert [m.id for m in rendered['recent_movements']][:1] == [9001]
+
+
+def test_simulation_margins_use_the_landed_cost_engine(client):
+    client, rendered = client
+    with application.app.app_context():
+        simulation = db.session.get(Simulation, 9001)
+        expected = landed_cost.landed_costs(simulation, simulation.items).total_margin
+
+    assert client.get('/').status_code == 200
+    recent = {sim.id: sim for sim in rendered['recent_simulations']}
+    assert recent[9001].total_margin_gnf == expected and len(recent[9001].items) == 2
+
+    assert client.get('/simulations').status_code == 200
+    listed = {sim.id: sim for sim in rendered['simulations']}
+    assert listed[9001].total_margin_gnf == expected
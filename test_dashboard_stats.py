@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du moteur de statistiques du tableau de bord (dashboard_stats)
+"""
+
+from datetime import datetime, UTC
+
+import pytest
+from sqlalchemy import event
+
+from models import db, User, CommercialOrder
+import dashboard_stats
+
+
+@pytest.fixture
+def app(app, seed):
+    dashboard_stats._store.local.clear()
+    seed.role()
+    seed.region(1, 'Conakry', code='CKY')
+    seed.region(2, 'Kindia', code='KND')
+    seed.user(1, 'u1', full_name='U1', role_id=1, region_id=1, is_active=True)
+    seed.user(2, 'u2', full_name='U2', role_id=1, region_id=2, is_active=False)
+    seed.depot(1, 'Dépôt CKY', region_id=1, is_active=True)
+    seed.depot(2, 'Dépôt KND', region_id=2, is_active=True)
+    seed.depot(3, 'Dépôt fermé', region_id=1, is_active=False)
+    seed.vehicle(1, 'AA-1', brand='Toyota', current_user_id=1, status='active')
+    seed.vehicle(2, 'AA-2', brand='Toyota', current_user_id=2, status='active')
+    db.session.commit()
+    yield app
+    dashboard_stats._store.local.clear()
+
+
+def test_counts_are_scoped_by_region(app):
+    global_stats = dashboard_stats.compute_dashboard_stats(None)
+    assert global_stats['regions_count'] == 2
+    assert global_stats['depots_count'] == 2
+    assert global_stats['vehicles_count'] == 2
+    assert global_stats['total_users'] == 2
+    assert global_stats['active_users'] == 1
+    assert global_stats['user_region_name'] is None
+
+    region_stats = dashboard_stats.compute_dashboard_stats(1)
+    assert region_stats['depots_count'] == 1
+    assert region_stats['vehicles_count'] == 1
+    assert region_stats['total_users'] == 1
+    assert region_stats['user_region_name'] == 'Conakry'
+
+
+def test_few_queries_and_commit_invalidation(app):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        stats = dashboard_stats.get_dashboard_stats(1)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    # Un SELECT par domaine + le nom de la région (au lieu d'une requête par compteur)
+    assert len(statements) <= 7
+    assert stats['orders_count'] == 0
+
+    # Entrée fraîche : servie sans recalcul
+    entry = dashboard_stats._store.local[dashboard_stats.cache_key(1)]
+    assert entry['generation'] == dashboard_stats._store.generation()
+
+    db.session.add(CommercialOrder(id=1, reference='CMD-1', commercial_id=1, region_id=1,
+                                   status='draft'))
+    db.session.commit()
+    # Le commit a rendu l'entrée périmée ; un recalcul la remet à jour
+    assert entry['generation'] != dashboard_stats._store.generation()
+    assert dashboard_stats.refresh(1)['orders_pending'] == 1
+
+    # Connexion d'un utilisateur (last_login) : pas d'invalidation ; région modifiée : invalidation
+    generation = dashboard_stats._store.generation()
+    db.session.get(User, 1).last_login = datetime.now(UTC)
+    db.session.commit()
+    assert dashboard_stats._store.generation() == generation
+    db.session.get(User, 2).region_id = 1
+    db.session.commit()
+    assert dashboard_stats._store.generation() == generation + 1
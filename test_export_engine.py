@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du moteur d'export (export_engine) : XlsxWriter constant_memory, CSV en flux,
+exports volumineux en tâche de fond
+"""
+
+import tracemalloc
+from decimal import Decimal
+
+import openpyxl
+import pytest
+from flask_login import login_user
+from sqlalchemy import event
+from werkzeug.datastructures import MultiDict
+
+from models import db, User, StockItem, BackgroundJob
+import export_engine
+import job_queue
+import referentiels  # noqa: F401  (déclare l'export 'referentiels.stock_items')
+
+
+@pytest.fixture
+def app(app, seed, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, 'EMBEDDED_WORKER', False)
+    monkeypatch.setattr(export_engine, 'EXPORT_DIR', str(tmp_path / 'exports'))
+    monkeypatch.setattr(export_engine, 'EXPORT_BATCH_SIZE', 500)
+    app.register_blueprint(export_engine.exports_bp)
+    app.add_url_rule('/', 'index', lambda: 'Accueil')
+    seed.user(1, 'admin')
+    seed.user(2, 'autre')
+    seed.family()
+    db.session.commit()
+    return app
+
+
+def _add_items(count, start=1):
+    db.session.execute(StockItem.__table__.insert(), [
+        {'id': i, 'sku': f'SKU-{i:06d}', 'name': f'Article {i:06d}', 'family_id': 1,
+         'purchase_price_gnf': Decimal('1500.50'), 'unit_weight_kg': Decimal('2'), 'is_active': i % 3 != 0,
+         'min_stock_depot': Decimal('0'), 'min_stock_vehicle': Decimal('0'),
+         'description': 'Climatiseur split inverter très haut rendement énergétique' if i == 7 else None}
+        for i in range(start, start + count)
+    ])
+    db.session.commit()
+
+
+def _peak_memory(definition, path):
+    db.session.expunge_all()
+    tracemalloc.start()
+    try:
+        export_engine.write_xlsx(definition, export_engine.iter_rows(definition, MultiDict()), path)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_xlsx_is_streamed_by_batches_with_bounded_memory(app, tmp_path):
+    definition = export_engine.get_export('referentiels.stock_items')
+    _add_items(1500)
+
+    selects = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: selects.append(args[2]))
+    count = export_engine.write_xlsx(definition, export_engine.iter_rows(definition, MultiDict({'status': 'active'})),
+                                     str(tmp_path / 'articles.xlsx'))
+    assert count == 1000
+    assert len(selects) == 1  # un seul SELECT, lu par lots
+
+    sheet = openpyxl.load_workbook(tmp_path / 'articles.xlsx')['Articles de Stock']
+    assert [cell.value for cell in sheet[1]][:3] == ['SKU', 'Nom', 'Famille']
+    assert sheet.max_row == 1001  # pas de ligne TOTAL pour les articles
+    assert sheet['A2'].value == 'SKU-000001' and sheet['D2'].value == 1500.5
+    assert 50 < sheet.column_dimensions['F'].width < 53  # largeur plafonnée (max_width=50)
+
+    # Mémoire de pointe indépendante du nombre de lignes
+    small = _peak_memory(definition, str(tmp_path / 'small.xlsx'))
+    _add_items(6000, start=1501)
+    large = _peak_memory(definition, str(tmp_path / 'large.xlsx'))
+    assert large < small * 1.5
+
+
+def test_csv_is_streamed_with_totals_free_header(app):
+    _add_items(3)
+    with app.app_context(), app.test_request_context('/?format=csv&search=Article 00000'):
+        login_user(db.session.get(User, 1))
+        response = export_engine.export_response('referentiels.stock_items')
+        assert response.is_streamed
+        assert response.headers['Content-Disposition'].endswith('.csv"')
+        lines = b''.join(response.response).decode('utf-8-sig').splitlines()
+    assert lines[0].startswith('SKU;Nom;Famille')
+    assert [line.split(';')[0] for line in lines[1:]] == ['SKU-000001', 'SKU-000002', 'SKU-000003']
+
+
+def test_large_export_runs_as_background_job(app, monkeypatch):
+    monkeypatch.setattr(export_engine, 'EXPORT_ASYNC_THRESHOLD', 10)
+    _add_items(25)
+    with app.app_context(), app.test_request_context('/?status=active'):
+        login_user(db.session.get(User, 1))
+        response = export_engine.export_response('referentiels.stock_items')
+        assert response.status_code == 302
+    job = db.session.query(BackgroundJob).one()
+    assert response.location.endswith(f'/exports/{job.id}')
+    assert (job.task, job.payload['user_id'], job.payload['args']) == ('exports.build', 1, [['status', 'active']])
+
+    assert job_queue.process_available(worker='w1') == 1
+    db.session.refresh(job)
+    assert job.status == 'succeeded' and job.result['rows'] == 17
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '2'
+    with app.app_context():  # contexte propre : g (utilisateur connecté) d'une vraie requête
+        assert client.get(f'/exports/{job.id}').status_code == 302  # export d'un autre utilisateur
+
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+    with app.app_context():
+        download = client.get(f'/exports/{job.id}')
+        assert download.status_code == 200
+        assert download.headers['Content-Disposition'].startswith('attachment; filename=stock_items_export_')
+        assert download.data.startswith(b'PK')
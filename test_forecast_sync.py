@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la synchronisation commandes validées → prévisions (forecast_sync)
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from models import (
+    db, Forecast, ForecastItem, CommercialOrder, CommercialOrderClient, CommercialOrderItem
+)
+import forecast_sync
+
+
+@pytest.fixture
+def app(app, seed):
+    seed.role()
+    seed.family(name='Famille')
+    seed.user(username='c1', role_id=1)
+    seed.stock_items([1, 2])
+    db.session.add(Forecast(id=1, name='Octobre', start_date=date(2026, 10, 1),
+                            end_date=date(2026, 10, 31), status='active'))
+    db.session.add_all([
+        ForecastItem(id=1, forecast_id=1, stock_item_id=1, forecast_quantity=Decimal('100')),
+        ForecastItem(id=2, forecast_id=1, stock_item_id=2, forecast_quantity=Decimal('0')),
+    ])
+    db.session.commit()
+    return app
+
+
+def _add_order(order_id, order_date, status='validated', lines=(), rejected_client=False):
+    order = CommercialOrder(id=order_id, reference=f'CMD-{order_id}', commercial_id=1,
+                            order_date=order_date, status=status)
+    db.session.add(order)
+    client = CommercialOrderClient(id=order_id, order_id=order_id, client_name='Client',
+                                   status='rejected' if rejected_client else 'pending')
+    db.session.add(client)
+    for line_id, (item_id, quantity, price) in enumerate(lines, start=order_id * 10):
+        db.session.add(CommercialOrderItem(id=line_id, order_client_id=client.id, stock_item_id=item_id,
+                                           quantity=Decimal(quantity), unit_price_gnf=Decimal(price)))
+    db.session.commit()
+    return order
+
+
+def test_full_recalculation_matches_incremental(app):
+    _add_order(1, datetime(2026, 10, 5, 9), lines=[(1, '10', '1000'), (2, '4', '500')])
+    _add_order(2, datetime(2026, 10, 31, 18), lines=[(1, '15', '1000')])
+    _add_order(3, datetime(2026, 11, 1, 8), lines=[(1, '50', '1000')])          # hors période
+    _add_order(4, datetime(2026, 10, 6), status='draft', lines=[(1, '50', '1000')])  # non validée
+    _add_order(5, datetime(2026, 10, 7), lines=[(1, '50', '1000')], rejected_client=True)
+
+    result = forecast_sync.recalculate_all_forecasts_from_orders()
+    assert result['orders_processed'] == 4
+    assert result['forecasts_updated'] == 1
+
+    item_1 = db.session.get(ForecastItem, 1)
+    assert item_1.realized_quantity == Decimal('25')
+    assert item_1.realized_value_gnf == Decimal('25000')
+    assert item_1.realization_percentage == Decimal('25')
+    assert db.session.get(Forecast, 1).total_realized_value == Decimal('27000')
+
+    # Mode incrémental : seule la nouvelle commande est appliquée
+    order = _add_order(6, datetime(2026, 10, 20), lines=[(1, '5', '1000')])
+    delta = forecast_sync.update_forecasts_from_order(order)
+    assert delta['updated'] == 1 and delta['items_updated'] == 1
+    item_1 = db.session.get(ForecastItem, 1)
+    assert item_1.realized_quantity == Decimal('30')
+    assert item_1.realization_percentage == Decimal('30')
+    assert db.session.get(Forecast, 1).total_realized_value == Decimal('32000')
+
+    # Un recalcul complet aboutit au même état
+    forecast_sync.recalculate_all_forecasts_from_orders()
+    assert db.session.get(ForecastItem, 1).realized_quantity == Decimal('30')
+    assert db.session.get(Forecast, 1).total_realized_value == Decimal('32000')
+
+
+def test_realization_detail(app):
+    _add_order(1, datetime(2026, 10, 5), lines=[(1, '10', '1000')])
+    detail = forecast_sync.get_forecast_realization_from_orders(1)
+    assert detail['orders_count'] == 1
+    assert detail['items'][1]['realized_quantity'] == 10
+    assert detail['items'][2]['realized_quantity'] == 0
+    assert detail['total_realized_value'] == 10000
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la validation des sessions d'inventaire (inventory_validation)
+"""
+
+import time
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event, func, select, update
+
+from models import (db, StockMovement, DepotStock, InventorySession, InventoryDetail,
+                    InventoryValidationJob, BackgroundJob)
+import inventory_validation
+import job_queue
+import stock_ledger
+import stock_mutations
+
+
+@pytest.fixture
+def app(app, seed):
+    seed.user(username='magasin')
+    seed.family()
+    seed.depot(1, 'Dépôt A')
+    seed.stock_items(range(1, 1201))
+    db.session.commit()
+    # Stock initial : 10 unités par article sauf les articles multiples de 7 (pas de ligne de stock)
+    stock_mutations.record_movements([
+        {'movement_type': 'reception', 'stock_item_id': i, 'quantity': Decimal('10'),
+         'user_id': 1, 'to_depot_id': 1}
+        for i in range(1, 1201) if i % 7
+    ])
+    db.session.commit()
+    return app
+
+
+def _session(session_id, item_ids):
+    """Session complétée : une ligne par article, comptée à (id % 5) + 8"""
+    db.session.add(InventorySession(id=session_id, depot_id=1, operator_id=1, status='completed'))
+    db.session.add_all([
+        InventoryDetail(session_id=session_id, stock_item_id=i, system_quantity=Decimal('10'),
+                        counted_quantity=Decimal(i % 5 + 8), variance=Decimal(2 - i % 5))
+        for i in item_ids
+    ])
+    db.session.commit()
+
+
+def _levels(item_ids):
+    rows = db.session.execute(
+        select(DepotStock.stock_item_id, DepotStock.quantity)
+        .where(DepotStock.depot_id == 1, DepotStock.stock_item_id.in_(item_ids))
+    ).all()
+    return {item_id: Decimal(str(quantity)) for item_id, quantity in rows}
+
+
+def _validate_counting_statements(session_id):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    started = time.perf_counter()
+    try:
+        created = inventory_validation.validate_session(session_id, 1)
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    return created, len(statements), time.perf_counter() - started
+
+
+def test_validation_sets_counted_levels_with_constant_statements(app):
+    small_items, large_items = list(range(1, 21)), list(range(21, 1201))
+    _session(1, small_items)
+    _session(2, large_items)
+
+    small_created, small_statements, small_seconds = _validate_counting_statements(1)
+    large_created, large_statements, large_seconds = _validate_counting_statements(2)
+    print(f"\n{len(small_items)} lignes : {small_statements} instructions, {small_seconds * 1000:.1f} ms"
+          f"\n{len(large_items)} lignes : {large_statements} instructions, {large_seconds * 1000:.1f} ms")
+
+    # Variance nulle (id % 5 == 2) : pas d'ajustement
+    assert small_created == sum(1 for i in small_items if i % 5 != 2)
+    assert large_created == sum(1 for i in large_items if i % 5 != 2)
+    assert large_statements == small_statements
+
+    levels = _levels(small_items + large_items)
+    assert all(levels[i] == i % 5 + 8 for i in small_items + large_items if i % 5 != 2)
+    # Article sans ligne de stock au départ : créé avec la quantité comptée
+    assert levels[14] == 12
+    adjustment = db.session.scalars(
+        select(StockMovement).where(StockMovement.inventory_session_id == 1, StockMovement.stock_item_id == 14)
+    ).one()
+    assert (adjustment.movement_type, adjustment.quantity, adjustment.to_depot_id) == ('adjustment', 12, 1)
+    assert db.session.get(InventorySession, 2).status == 'validated'
+    assert stock_ledger.verify_ledger()['ok']
+
+    with pytest.raises(inventory_validation.InventoryValidationError):
+        inventory_validation.validate_session(1, 1)
+
+
+def test_background_job_validates_once_and_reports_progress(app):
+    _session(1, range(1, 51))
+    job = inventory_validation.start_validation(1, requested_by_id=1, run_async=False)
+    progress = inventory_validation.job_progress(job)
+    assert (progress['status'], progress['total_lines'], progress['adjustments'], progress['percent']) == (
+        'completed', 50, 40, 100.0)
+    assert db.session.get(InventorySession, 1).status == 'validated'
+
+    # Un nouveau job sur une session validée échoue sans rien écrire
+    movements = db.session.execute(select(func.count(StockMovement.id))).scalar()
+    job = inventory_validation.start_validation(1, requested_by_id=1, run_async=False)
+    assert job.status == 'failed' and 'déjà validée' in job.error
+    assert db.session.execute(select(func.count(StockMovement.id))).scalar() == movements
+    assert db.session.execute(select(func.count(InventoryValidationJob.id))).scalar() == 2
+
+
+def test_background_validation_runs_as_a_job_queue_task(app, monkeypatch):
+    monkeypatch.setattr(job_queue, 'EMBEDDED_WORKER', False)
+    _session(1, range(1, 31))
+    job = inventory_validation.start_validation(1, requested_by_id=1)
+    assert job.status == 'pending' and job.worker.startswith('job_queue:')
+    # Relance pendant que la tâche attend : même job, pas de seconde tâche
+    assert inventory_validation.start_validation(1, requested_by_id=1).id == job.id
+    assert job_queue.stats()['pending'] == 1
+    assert not inventory_validation.job_progress(job)['stale']
+
+    assert job_queue.process_available(worker='w1') == 1
+    db.session.refresh(job)
+    assert (job.status, job.adjustments) == ('completed', 24)
+    assert db.session.get(InventorySession, 1).status == 'validated'
+
+    # Tâche sortie de la file sans exécuter la validation : job abandonné, repris par une nouvelle tâche
+    _session(2, range(1, 11))
+    stuck = inventory_validation.start_validation(2, requested_by_id=1)
+    db.session.execute(update(BackgroundJob).where(BackgroundJob.status == 'pending').values(status='dead'))
+    db.session.commit()
+    assert inventory_validation.job_progress(stuck)['stale']
+    restarted = inventory_validation.start_validation(2, requested_by_id=1)
+    assert restarted.id == stuck.id and not inventory_validation.job_progress(restarted)['stale']
+    assert job_queue.process_available(worker='w1') == 1
+    db.session.refresh(restarted)
+    assert restarted.status == 'completed'
+    assert db.session.execute(select(func.count(InventoryValidationJob.id))).scalar() == 2
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la file de tâches durable (job_queue)
+Worker intégré désactivé : les tâches sont traitées explicitement
+"""
+
+import sys
+import time
+import types
+from datetime import datetime, timedelta, UTC
+from io import BytesIO
+
+import pytest
+from sqlalchemy import func, select, update
+
+from models import db, BackgroundJob, Family
+import job_queue
+from notifications_automatiques import notifications_automatiques
+
+calls = []
+
+
+@job_queue.task('tests.enregistrer', queue='tests')
+def enregistrer(name, fail_times=0):
+    calls.append(name)
+    if calls.count(name) <= fail_times:
+        raise RuntimeError(f"API indisponible ({name})")
+    return {'name': name}
+
+
+@job_queue.task('tests.refus', queue='tests')
+def refus():
+    raise job_queue.PermanentJobError("Destinataire invalide")
+
+
+@job_queue.task('tests.observer', queue='tests')
+def observer():
+    # Statuts de toutes les tâches pendant l'exécution de celle-ci
+    calls.append(db.session.execute(select(BackgroundJob.status).order_by(BackgroundJob.id)).scalars().all())
+    db.session.commit()
+
+
+@job_queue.task('tests.longue', queue='tests')
+def longue(duration):
+    # Réservation vieillie comme après un long traitement, puis battements pendant la tâche
+    db.session.execute(update(BackgroundJob).where(BackgroundJob.status == 'running')
+                       .values(locked_at=datetime.now(UTC) - job_queue.VISIBILITY_TIMEOUT - timedelta(seconds=1)))
+    db.session.commit()
+    time.sleep(duration)
+    calls.append(job_queue.claim_jobs(worker='w2'))
+
+
+@pytest.fixture
+def app(app, monkeypatch):
+    monkeypatch.setattr(job_queue, 'EMBEDDED_WORKER', False)
+    calls.clear()
+    return app
+
+
+def _make_due(job_id):
+    db.session.execute(update(BackgroundJob).where(BackgroundJob.id == job_id)
+                       .values(run_after=datetime.now(UTC) - timedelta(seconds=1)))
+    db.session.commit()
+
+
+def test_enqueue_is_transactional_and_idempotent(app):
+    # Tâche enregistrée avec l'action métier : un rollback annule les deux
+    db.session.add(Family(id=1, name='Froid'))
+    job_queue.enqueue('tests.enregistrer', {'name': 'annulée'})
+    db.session.rollback()
+    assert db.session.execute(select(func.count(BackgroundJob.id))).scalar() == 0
+
+    db.session.add(Family(id=1, name='Froid'))
+    first = job_queue.enqueue('tests.enregistrer', {'name': 'commande'}, idempotency_key='commande_validee:1')
+    second = job_queue.enqueue('tests.enregistrer', {'name': 'commande'}, idempotency_key='commande_validee:1')
+    db.session.commit()
+    assert first == second
+    assert db.session.execute(select(func.count(BackgroundJob.id))).scalar() == 1
+
+    assert job_queue.process_available(worker='w1') == 1
+    assert job_queue.process_available(worker='w1') == 0
+    job = db.session.get(BackgroundJob, first)
+    assert (job.status, job.attempts, job.result) == ('succeeded', 1, {'name': 'commande'})
+    assert calls == ['commande']
+
+    with pytest.raises(ValueError):
+        job_queue.enqueue('tests.inconnue')
+
+
+def test_failures_are_retried_with_backoff_then_dead_lettered(app):
+    job_id = job_queue.enqueue('tests.enregistrer', {'name': 'rappel', 'fail_times': 5}, max_attempts=2)
+    db.session.commit()
+
+    assert job_queue.process_available(worker='w1') == 1
+    job = db.session.get(BackgroundJob, job_id)
+    db.session.refresh(job)
+    assert (job.status, job.attempts) == ('pending', 1)
+    assert 'API indisponible' in job.last_error
+    # Backoff : pas de nouvelle tentative avant l'échéance
+    assert job.run_after.replace(tzinfo=None) > datetime.now(UTC).replace(tzinfo=None)
+    assert job_queue.process_available(worker='w1') == 0
+
+    _make_due(job_id)
+    job_queue.process_available(worker='w1')
+    db.session.refresh(job)
+    assert (job.status, job.attempts) == ('dead', 2)
+    assert [dead.id for dead in job_queue.list_jobs('dead')] == [job_id]
+    assert job_queue.stats()['dead'] == 1
+
+    # Relance manuelle depuis la file des échecs
+    assert job_queue.retry_job(job_id)
+    db.session.execute(update(BackgroundJob).where(BackgroundJob.id == job_id)
+                       .values(payload={'name': 'rappel', 'fail_times': 0}))
+    db.session.commit()
+    job_queue.process_available(worker='w1')
+    db.session.refresh(job)
+    assert (job.status, job.attempts) == ('succeeded', 1)
+
+
+def test_permanent_errors_and_abandoned_jobs(app):
+    refused = job_queue.enqueue('tests.refus')
+    abandoned = job_queue.enqueue('tests.enregistrer', {'name': 'reprise'})
+    db.session.commit()
+
+    # Un worker réserve la tâche puis disparaît : elle est reprise après le délai de visibilité
+    assert sorted(job_queue.claim_jobs(worker='w1')) == sorted([refused, abandoned])
+    assert job_queue.claim_jobs(worker='w2') == []
+    db.session.execute(update(BackgroundJob).where(BackgroundJob.id.in_([refused, abandoned]))
+                       .values(locked_at=datetime.now(UTC) - job_queue.VISIBILITY_TIMEOUT - timedelta(seconds=1)))
+    db.session.commit()
+    assert job_queue.process_available(worker='w2') == 2
+    # L'ancien worker ne peut plus écrire l'issue d'une tâche reprise
+    assert not job_queue.run_job(abandoned, worker='w1')
+
+    assert db.session.get(BackgroundJob, refused).status == 'dead'
+    assert 'Destinataire invalide' in db.session.get(BackgroundJob, refused).last_error
+    assert db.session.get(BackgroundJob, abandoned).status == 'succeeded'
+    assert calls == ['reprise']
+
+
+def test_jobs_are_claimed_one_at_a_time_and_kept_while_running(app, monkeypatch):
+    first = job_queue.enqueue('tests.observer')
+    second = job_queue.enqueue('tests.observer')
+    db.session.commit()
+
+    # La seconde tâche reste disponible pour les autres workers pendant la première
+    assert job_queue.process_available(worker='w1') == 2
+    assert calls == [['running', 'pending'], ['succeeded', 'running']]
+    assert {db.session.get(BackgroundJob, job_id).status for job_id in (first, second)} == {'succeeded'}
+
+    # Tâche longue : la réservation est prolongée, un autre worker ne la reprend pas
+    calls.clear()
+    monkeypatch.setattr(job_queue, 'HEARTBEAT_INTERVAL', 0.05)
+    slow = job_queue.enqueue('tests.longue', {'duration': 0.5})
+    db.session.commit()
+    assert job_queue.process_available(worker='w1') == 1
+    assert calls == [[]]
+    job = db.session.get(BackgroundJob, slow)
+    assert (job.status, job.attempts) == ('succeeded', 1)
+
+
+def test_notification_retry_only_resends_to_failed_recipients(app, monkeypatch):
+    sends = []
+
+    class FakeAPI:
+        def get_whatsapp_accounts(self, limit=10):
+            return {'status': 200, 'data': [{'id': 'compte-1'}]}
+
+        def send_whatsapp(self, recipient, **kwargs):
+            sends.append(recipient)
+            # Le second destinataire est refusé au premier essai seulement
+            if recipient == '224620000002' and sends.count(recipient) == 1:
+                return {'status': 500, 'message': 'Indisponible'}
+            return {'status': 200}
+
+    pdf_generator = types.SimpleNamespace(generate_stock_summary_pdf=lambda *args, **kwargs: BytesIO(b'%PDF-1.4'))
+    monkeypatch.setattr(notifications_automatiques, 'messagepro_api', FakeAPI())
+    monkeypatch.setattr(notifications_automatiques, 'pdf_generator', pdf_generator)
+    monkeypatch.setitem(sys.modules, 'stocks',
+                        types.SimpleNamespace(generate_stock_summary_pdf_data=lambda **kwargs: {'items': []}))
+
+    recipients = ['224620000001', '224620000002', '224620000003']
+    job_id = job_queue.enqueue('notifications.inventaire_stock', {'recipients': recipients})
+    db.session.commit()
+
+    assert job_queue.process_available(worker='w1') == 1
+    job = db.session.get(BackgroundJob, job_id)
+    assert (job.status, job.payload['delivered']) == ('pending', ['224620000001', '224620000003'])
+
+    _make_due(job_id)
+    assert job_queue.process_available(worker='w1') == 1
+    db.session.refresh(job)
+    assert job.status == 'succeeded'
+    assert sends == recipients + ['224620000002']
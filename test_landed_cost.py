@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du moteur de prix de revient (landed_cost) : parité Decimal exacte avec
+les anciennes formules article par article, grilles de scénarios vectorisées
+et API de rentabilité
+"""
+
+from decimal import Decimal
+
+import pytest
+from flask_login import login_user
+
+from models import db, User, Category, Article, Simulation, SimulationItem
+from api_profitability import profitability_api
+import landed_cost
+
+D = Decimal
+
+SIMULATION = dict(rate_usd=D('8650.5'), rate_eur=D('9420.25'), rate_xof=D('0'), customs_gnf=D('1250000'),
+                  handling_gnf=D('340000.50'), others_gnf=D('75000'), transport_fixed_gnf=D('900000'),
+                  transport_per_kg_gnf=D('312.75'), truck_capacity_tons=D('2.5'), basis='value')
+
+ITEMS = [
+    dict(purchase_price=D('12.35'), purchase_currency='USD', quantity=D('120'), unit_weight_kg=D('1.250'),
+         selling_price_gnf=D('165000')),
+    dict(purchase_price=D('7.1'), purchase_currency='EUR', quantity=D('33'), unit_weight_kg=D('12.4'),
+         selling_price_gnf=D('98000.50')),
+    dict(purchase_price=D('4200'), purchase_currency='XOF', quantity=D('7'), unit_weight_kg=D('0.3333'),
+         selling_price_gnf=D('37000000')),
+    dict(purchase_price=D('3'), purchase_currency='USD', quantity=D('0'), unit_weight_kg=D('2'),
+         selling_price_gnf=D('30000')),
+]
+
+
+def _legacy(simulation, items):
+    """Anciennes formules de simulation_preview / simulation_excel, article par article"""
+    def rate_for(item):
+        rate = simulation['rate_usd']
+        if item['purchase_currency'] == 'EUR':
+            rate = simulation['rate_eur']
+        elif item['purchase_currency'] == 'XOF':
+            rate = simulation['rate_xof'] if simulation['rate_xof'] else simulation['rate_usd']
+        return rate
+
+    total_purchase_value, total_weight, total_selling_value = D('0'), D('0'), D('0')
+    for item in items:
+        purchase_price_gnf = D(str(item['purchase_price'])) * D(str(rate_for(item)))
+        total_purchase_value += purchase_price_gnf * D(str(item['quantity']))
+        total_weight += D(str(item['quantity'])) * D(str(item['unit_weight_kg']))
+        total_selling_value += D(str(item['selling_price_gnf'])) * D(str(item['quantity']))
+    total_logistics = (D(str(simulation['customs_gnf'])) + D(str(simulation['handling_gnf']))
+                       + D(str(simulation['others_gnf'])) + D(str(simulation['transport_fixed_gnf']))
+                       + D(str(simulation['transport_per_kg_gnf'])) * total_weight)
+
+    lines = []
+    for item in items:
+        purchase_price_gnf = D(str(item['purchase_price'])) * D(str(rate_for(item)))
+        item_value = purchase_price_gnf * D(str(item['quantity']))
+        item_weight = D(str(item['quantity'])) * D(str(item['unit_weight_kg']))
+        if simulation['basis'] == 'weight' and total_weight > 0:
+            logistics_cost = (total_logistics * item_weight) / total_weight
+        else:
+            logistics_cost = (total_logistics * item_value) / total_purchase_value if total_purchase_value > 0 else D('0')
+        logistics_per_unit = logistics_cost / D(str(item['quantity'])) if item['quantity'] > 0 else D('0')
+        cost_price_per_unit = purchase_price_gnf + logistics_per_unit
+        margin = D(str(item['selling_price_gnf'])) - cost_price_per_unit
+        lines.append({
+            'purchase_price_gnf': purchase_price_gnf,
+            'logistics_per_unit': logistics_per_unit,
+            'cost_price_per_unit': cost_price_per_unit,
+            'total_cost': cost_price_per_unit * D(str(item['quantity'])),
+            'margin': margin,
+            'margin_pct': (margin / cost_price_per_unit * 100) if cost_price_per_unit > 0 else D('0'),
+        })
+    total_cost = total_purchase_value + total_logistics
+    return lines, {'total_purchase_value': total_purchase_value, 'total_selling_value': total_selling_value,
+                   'total_logistics': total_logistics, 'total_cost': total_cost,
+                   'total_margin': total_selling_value - total_cost}
+
+
+@pytest.mark.parametrize('overrides', [
+    {},
+    {'basis': 'weight'},
+    {'rate_xof': D('14.7')},
+    {'transport_per_kg_gnf': D('0'), 'customs_gnf': D('0')},
+])
+def test_exact_decimal_parity_with_legacy_formulas(overrides):
+    simulation = dict(SIMULATION, **overrides)
+    legacy_lines, legacy_totals = _legacy(simulation, ITEMS)
+    result = landed_cost.landed_costs(simulation, ITEMS)
+
+    for line, expected in zip(result.lines, legacy_lines):
+        for field, value in expected.items():
+            assert isinstance(line[field], Decimal) and line[field] == value, field
+    for name, value in legacy_totals.items():
+        assert getattr(result, name) == value, name
+
+    # Base 'weight' sans poids saisi : prorata de la valeur, comme la prévisualisation
+    weightless = [dict(item, unit_weight_kg=D('0')) for item in ITEMS]
+    assert [line['logistics_cost'] for line in landed_cost.landed_costs(dict(simulation, basis='weight'),
+                                                                         weightless).lines] == \
+           [line['logistics_cost'] for line in landed_cost.landed_costs(dict(simulation, basis='value'),
+                                                                         weightless).lines]
+    empty = landed_cost.landed_costs(simulation, [])
+    assert empty.lines == [] and empty.total_purchase_value == 0
+
+
+def test_scenario_grid_matches_exact_path_per_scenario():
+    scenarios = {'rate_usd': [8000, 8650.5, 9500, 9500], 'customs_gnf': [0, 1250000, 2000000, 2000000],
+                 'truck_capacity_tons': [2.5, 2.5, 0.5, 0]}
+    grid = landed_cost.evaluate_scenarios(SIMULATION, ITEMS, scenarios)
+    assert grid.count == 4 and grid.cost_price_per_unit.shape == (4, len(ITEMS))
+
+    for index in range(grid.count):
+        exact = landed_cost.landed_costs(
+            dict(SIMULATION, **{name: D(str(values[index])) for name, values in scenarios.items()}), ITEMS)
+        assert grid.total_cost[index] == pytest.approx(float(exact.total_cost), rel=1e-12)
+        assert grid.margin_pct[index] == pytest.approx(float(exact.margin_pct), rel=1e-12)
+        assert list(grid.cost_price_per_unit[index]) == pytest.approx(
+            [float(line['cost_price_per_unit']) for line in exact.lines], rel=1e-12)
+        assert grid.truck_overflow[index] == exact.truck_overflow
+
+    # 150 + 409,2 + 2,3331 kg : dans un camion de 2,5 t, pas dans un de 0,5 t ; capacité 0 = non renseignée
+    assert list(grid.truck_overflow) == [False, False, True, False]
+    assert grid.truck_utilization_pct[0] == pytest.approx(561.5331 / 2500 * 100)
+
+    with pytest.raises(ValueError):
+        landed_cost.evaluate_scenarios(SIMULATION, ITEMS, {'rate_usd': [1, 2], 'customs_gnf': [1]})
+
+
+@pytest.fixture
+def client(app, seed):
+    app.register_blueprint(profitability_api)
+
+    @app.route('/login-test')
+    def login_test():
+        login_user(db.session.get(User, 1))
+        return 'ok'
+
+    seed.user()
+    db.session.add_all([Category(id=1, name='Catégorie'), Simulation(id=1, **SIMULATION)])
+    db.session.flush()
+    db.session.add_all([Article(id=i, name=f'Article {i}', category_id=1) for i in range(1, len(ITEMS) + 1)])
+    db.session.flush()
+    db.session.add_all([SimulationItem(id=i, simulation_id=1, article_id=i, **item)
+                        for i, item in enumerate(ITEMS, start=1)])
+    db.session.commit()
+    with app.test_client() as client:
+        yield client
+
+
+def test_profitability_api_uses_the_engine(client):
+    assert client.post('/api/profitability/calculate', json={'simulation_id': 1}).status_code == 401
+    client.get('/login-test')
+
+    exact = landed_cost.landed_costs(SIMULATION, ITEMS)
+    data = client.post('/api/profitability/calculate', json={'simulation_id': 1}).get_json()['data']
+    assert data['totals']['total_costs'] == pytest.approx(float(exact.total_cost))
+    assert data['totals']['margin_pct'] == pytest.approx(float(exact.margin_pct))
+    assert data['truck'] == {'utilization_pct': pytest.approx(561.5331 / 2500 * 100), 'overflow': False,
+                             'capacity_kg': 2500.0}
+    assert [item['article_id'] for item in data['items']] == [1, 2, 3, 4]
+
+    # Simulation non enregistrée, envoyée telle quelle
+    payload = {'simulation': {k: str(v) for k, v in SIMULATION.items()},
+               'items': [{k: str(v) for k, v in item.items()} for item in ITEMS]}
+    inline = client.post('/api/profitability/calculate', json=payload).get_json()['data']
+    assert inline['totals'] == data['totals']
+
+    sensitivity = client.post('/api/profitability/sensitivity',
+                              json={'simulation_id': 1, 'variations': {'rate_usd': [-10, 10]},
+                                    'scenarios': [{'truck_capacity_tons': 0.5}]}).get_json()['data']
+    assert sensitivity['base_margin'] == pytest.approx(float(exact.margin_pct))
+    lower, higher = sensitivity['sensitivity']['rate_usd']
+    assert lower['new_value'] == pytest.approx(8650.5 * 0.9) and lower['new_margin'] > higher['new_margin']
+    assert sensitivity['scenarios'][0]['truck_overflow'] is True
+
+    optimized = client.post('/api/profitability/optimize',
+                            json={'simulation_id': 1, 'target_margin_pct': 25, 'step': 500}).get_json()['data']
+    assert optimized['optimized_margin'] >= 25
+    for recommendation, line in zip(optimized['recommendations'], exact.lines):
+        assert recommendation['recommended_price'] % 500 == 0
+        assert recommendation['recommended_price'] >= float(line['cost_price_per_unit']) * 1.25
+
+    error = client.post('/api/profitability/calculate', json={'simulation_id': 999})
+    assert error.status_code == 404 and error.get_json()['success'] is False
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du client Message Pro (messagepro_api) contre un serveur HTTP local
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pytest
+
+import messagepro_api
+from messagepro_api import MessageProAPI
+from models import ApiConfig
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        path = urlparse(self.path).path.removeprefix('/api/')
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, path, self.client_address[1]))
+            count = sum(1 for _, p, _ in server.requests if p == path)
+        if path == 'get/credits' and count == 1:
+            return self._reply(503, {'status': 503, 'message': 'Surcharge'})
+        if path == 'send/sms':
+            return self._reply(503, {'status': 503, 'message': 'Surcharge'})
+        self._reply(200, {'status': 200, 'message': 'OK', 'data': [{'id': f'{path}-{count}'}]})
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests, server.lock = [], threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(MessageProAPI, 'BASE_URL', f'http://127.0.0.1:{server.server_port}/api')
+    monkeypatch.setattr(messagepro_api, 'RETRY_BACKOFF', 0)
+    messagepro_api.reset_session()
+    messagepro_api.clear_cache(secret=True)
+    messagepro_api.reset_metrics()
+    yield server
+    server.shutdown()
+    server.server_close()
+    messagepro_api.reset_session()
+
+
+def test_reads_are_cached_retried_and_share_one_connection(stub):
+    api = MessageProAPI(api_secret='secret-test')
+    first = api.get_whatsapp_accounts(limit=10)
+    first['data'].append('modifié par l\'appelant')
+    assert api.get_whatsapp_accounts(limit=10) == {
+        'status': 200, 'message': 'OK', 'data': [{'id': 'get/wa.accounts-1'}]}
+    # Autres paramètres : autre entrée de cache
+    assert MessageProAPI(api_secret='secret-test').get_whatsapp_accounts(limit=50)['data'][0]['id'] == 'get/wa.accounts-2'
+
+    # 503 puis 200 : lecture retentée par le pool
+    assert api.get_credits()['status'] == 200
+
+    # Une écriture invalide la lecture en cache correspondante
+    api.get_groups()
+    api.create_group('Chauffeurs')
+    assert api.get_groups()['data'][0]['id'] == 'get/groups-2'
+
+    paths = [path for _, path, _ in stub.requests]
+    assert paths.count('get/wa.accounts') == 2
+    assert paths.count('get/credits') == 2
+    assert len({port for _, _, port in stub.requests}) == 1
+
+    metrics = messagepro_api.get_metrics()
+    assert (metrics['get/wa.accounts']['calls'], metrics['get/wa.accounts']['cache_hits']) == (2, 1)
+    assert (metrics['get/credits']['calls'], metrics['get/credits']['errors']) == (1, 0)
+
+
+def test_sends_are_not_replayed_and_errors_are_counted(stub):
+    api = MessageProAPI(api_secret='secret-test')
+    result = api.send_sms(phone='+224620000000', message='Bonjour')
+    assert result['status'] == 500 and result['data'] is None
+    assert [path for _, path, _ in stub.requests] == ['send/sms']
+    assert messagepro_api.get_metrics()['send/sms']['errors'] == 1
+
+
+def test_api_secret_is_read_once_per_ttl(stub, monkeypatch):
+    reads = []
+    monkeypatch.setattr(ApiConfig, 'get_api_secret', staticmethod(lambda name: reads.append(name) or 'secret-db'))
+    assert [MessageProAPI().api_secret for _ in range(5)] == ['secret-db'] * 5
+    assert reads == ['messagepro']
+
+    messagepro_api.clear_cache(secret=True)
+    MessageProAPI()
+    assert len(reads) == 2
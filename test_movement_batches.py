@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests des bons de mouvement (movement_batches) : rattachement des lignes,
+compteurs tenus en SQL, rattachement des données existantes, liste filtrée
+par nombre d'articles
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from models import db, DepotStock, StockMovement, StockMovementBatch
+import movement_batches
+import movement_listing
+import stock_mutations
+
+
+@pytest.fixture
+def app(app, seed):
+    seed.user()
+    seed.family()
+    seed.depot(1, 'Dépôt A')
+    seed.depot(2, 'Dépôt B')
+    seed.stock_items([1, 2, 3])
+    db.session.flush()
+    seed.vehicle(plate_number='RC-0001')
+    db.session.add_all([DepotStock(depot_id=1, stock_item_id=i, quantity=100) for i in (1, 2, 3)])
+    db.session.commit()
+    return app
+
+
+def _transfer_rows(base, item_ids, to_vehicle=False, day=None):
+    rows = []
+    for line_number, item_id in enumerate(item_ids, start=1):
+        common = dict(movement_type='transfer', stock_item_id=item_id, user_id=1, movement_date=day)
+        rows.append(dict(common, reference=movement_batches.line_reference(base, 'OUT', line_number),
+                         quantity=-2, from_depot_id=1))
+        rows.append(dict(common, reference=movement_batches.line_reference(base, 'IN', line_number), quantity=2,
+                         **({'to_vehicle_id': 1} if to_vehicle else {'to_depot_id': 2})))
+    return rows
+
+
+def test_bulk_and_orm_lines_share_one_batch_with_sql_counts(app):
+    stock_mutations.record_movements(_transfer_rows('TRANS-20260110-1', [1, 2, 3]))
+    stock_mutations.record_movements(_transfer_rows('TRANS-20260110-10', [1]))
+    db.session.commit()
+
+    batch = StockMovementBatch.query.filter_by(reference='TRANS-20260110-1').one()
+    assert (batch.lines_count, batch.items_count) == (6, 3)
+    assert (batch.movement_type, batch.user_id, batch.from_depot_id, batch.to_depot_id) == ('transfer', 1, 1, 2)
+    assert [m.reference for m in batch.movements] == [
+        'TRANS-20260110-1-OUT', 'TRANS-20260110-1-IN', 'TRANS-20260110-1-OUT-2',
+        'TRANS-20260110-1-IN-2', 'TRANS-20260110-1-OUT-3', 'TRANS-20260110-1-IN-3']
+    # Plus de confusion de préfixe : TRANS-20260110-10 est un autre bon
+    assert StockMovementBatch.query.filter_by(reference='TRANS-20260110-10').one().items_count == 1
+
+    # Ligne ajoutée par l'ORM, puis suppressions : compteurs recalculés au flush
+    db.session.add(StockMovement(reference='TRANS-20260110-10-IN-2', movement_type='transfer', stock_item_id=3,
+                                 quantity=1, user_id=1, to_depot_id=2))
+    db.session.commit()
+    small = StockMovementBatch.query.filter_by(reference='TRANS-20260110-10').one()
+    assert (small.lines_count, small.items_count) == (3, 2)
+
+    for movement in StockMovement.query.filter(StockMovement.stock_item_id == 3,
+                                               StockMovement.batch_id == batch.id):
+        db.session.delete(movement)
+    db.session.commit()
+    db.session.refresh(batch)
+    assert (batch.lines_count, batch.items_count) == (4, 2)
+
+    for movement in list(small.movements):
+        db.session.delete(movement)
+    db.session.commit()
+    assert StockMovementBatch.query.filter_by(reference='TRANS-20260110-10').first() is None
+
+
+def test_existing_movements_are_backfilled_by_base_reference(app):
+    day = datetime(2026, 1, 10, 9, 30)
+    stock_mutations.record_movements(
+        _transfer_rows('TRANS-20260110-1', [1, 2], day=day) + _transfer_rows('TRANS-20260110-2', [3], to_vehicle=True)
+        + [dict(reference='REC-20260110-1', movement_type='reception', stock_item_id=1, quantity=5, user_id=1,
+                to_depot_id=1)]
+    )
+    db.session.commit()
+    # Données d'avant la migration : aucun bon
+    db.session.execute(update(StockMovement).values(batch_id=None))
+    db.session.execute(StockMovementBatch.__table__.delete())
+    db.session.commit()
+
+    assert movement_batches.backfill_batches(batch_size=2) == 7
+    batches = {b.reference: b for b in StockMovementBatch.query}
+    assert sorted(batches) == ['REC-20260110-1', 'TRANS-20260110-1', 'TRANS-20260110-2']
+    first, second = batches['TRANS-20260110-1'], batches['TRANS-20260110-2']
+    assert (first.lines_count, first.items_count, first.movement_date) == (4, 2, day)
+    assert (second.from_depot_id, second.to_vehicle_id, second.to_depot_id) == (1, 1, None)
+    assert StockMovement.query.filter(StockMovement.batch_id.is_(None)).count() == 0
+    assert movement_batches.backfill_batches() == 0  # idempotent
+
+
+def test_items_count_filter_is_applied_before_pagination(app):
+    now = datetime.now().replace(microsecond=0)
+    for n in range(6):
+        item_ids = [1, 2] if n % 2 == 0 else [3]
+        stock_mutations.record_movements(_transfer_rows(f'TRANS-20260110-{n + 1}', item_ids,
+                                                        day=now - timedelta(minutes=n)))
+    db.session.commit()
+
+    query = StockMovement.query.join(StockMovementBatch, StockMovement.batch_id == StockMovementBatch.id)\
+                               .filter(StockMovementBatch.items_count == 2)
+    page = movement_listing.keyset_page(query, per_page=6)
+    assert len(page.items) == 6 and page.has_next  # 3 bons de 2 articles (12 lignes)
+    assert {m.batch.reference for m in page.items} == {'TRANS-20260110-1', 'TRANS-20260110-3'}
+    rest = movement_listing.keyset_page(query, after=page.next_cursor, per_page=6)
+    assert len(rest.items) == 6 and not rest.has_next
+    assert all(m.batch.items_count == 2 for m in page.items + rest.items)
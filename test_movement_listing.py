@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la liste des mouvements : pagination par curseur, compteurs journaliers,
+facettes et listes des filtres en cache (movement_listing)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from models import db, Depot, StockMovement, StockMovementDailyCount
+import movement_listing
+import stock_ledger
+import stock_mutations
+import utils_region_filter
+from utils_region_filter import UNRESTRICTED_SCOPE, RegionScope
+
+
+@pytest.fixture
+def app(app, seed):
+    movement_listing._store.local.clear()
+    utils_region_filter._store.local.clear()
+    seed.user()
+    seed.region(1, 'Conakry')
+    seed.family()
+    seed.stock_items([1])
+    db.session.flush()
+    seed.depot(1, 'Dépôt A', region_id=1)
+    seed.depot(2, 'Dépôt B')
+    db.session.commit()
+    yield app
+    movement_listing._store.local.clear()
+    utils_region_filter._store.local.clear()
+
+
+def _add_movements(count, start=1, day=None, movement_type='reception', depot_id=1):
+    """Mouvements ajoutés par l'ORM, plusieurs par date pour tester le départage par id"""
+    day = day or datetime.now().replace(microsecond=0)
+    db.session.add_all([
+        StockMovement(id=i, movement_type=movement_type, stock_item_id=1, quantity=1, user_id=1,
+                      to_depot_id=depot_id, movement_date=day - timedelta(minutes=(i - start) // 3))
+        for i in range(start, start + count)
+    ])
+    db.session.commit()
+
+
+def _daily_counts():
+    return {(row.day, row.movement_type): row.movements_count
+            for row in StockMovementDailyCount.query.all() if row.movements_count}
+
+
+def test_keyset_pages_are_stable_across_equal_dates(app):
+    _add_movements(25)
+    expected = [m.id for m in StockMovement.query.order_by(StockMovement.movement_date.desc(),
+                                                             StockMovement.id.desc())]
+
+    seen, cursor, pages = [], None, []
+    while True:
+        page = movement_listing.keyset_page(StockMovement.query, after=cursor, per_page=10)
+        pages.append(page)
+        seen.extend(m.id for m in page.items)
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+    assert seen == expected and [len(p.items) for p in pages] == [10, 10, 5]
+    assert not pages[0].has_prev and pages[1].has_prev
+
+    # Retour arrière depuis la troisième page : la deuxième page à l'identique
+    back = movement_listing.keyset_page(StockMovement.query, before=pages[2].prev_cursor, per_page=10)
+    assert [m.id for m in back.items] == [m.id for m in pages[1].items]
+    assert back.has_prev and back.has_next
+
+    # Un mouvement plus ancien ajouté entre deux pages n'est ni perdu ni dupliqué
+    _add_movements(1, start=100, day=datetime.now() - timedelta(days=1))
+    rest = movement_listing.keyset_page(StockMovement.query, after=pages[1].next_cursor, per_page=10)
+    assert [m.id for m in rest.items] == expected[20:] + [100]
+
+    assert movement_listing.decode_cursor('pas-un-curseur') is None
+
+
+def test_daily_counts_follow_orm_and_bulk_writes(app):
+    today = datetime.now().replace(microsecond=0)
+    _add_movements(4, day=today)
+    stock_mutations.record_movements([
+        {'movement_type': 'transfer', 'stock_item_id': 1, 'quantity': 2, 'user_id': 1,
+         'to_depot_id': 2, 'movement_date': today - timedelta(days=2)}
+        for _ in range(3)
+    ])
+    db.session.commit()
+
+    movement = db.session.get(StockMovement, 1)
+    movement.movement_type = 'adjustment'
+    db.session.delete(db.session.get(StockMovement, 2))
+    db.session.commit()
+
+    counts = _daily_counts()
+    assert counts == {(today.date(), 'reception'): 2, (today.date(), 'adjustment'): 1,
+                      ((today - timedelta(days=2)).date(), 'transfer'): 3}
+    assert stock_ledger.verify_ledger()['ok']
+
+    db.session.execute(StockMovementDailyCount.__table__.delete())
+    db.session.commit()
+    assert not stock_ledger.verify_ledger()['ok']
+    assert stock_ledger.rebuild_daily_counts() == 3
+    assert _daily_counts() == counts
+
+    facets = movement_listing.movement_facets(UNRESTRICTED_SCOPE)
+    assert facets['total'] == 6
+    assert facets['by_type'] == {'transfer': 3, 'reception': 2, 'adjustment': 1, 'inventory': 0}
+    assert facets['chart_total'] == [3, 3] and facets['chart_transfer'] == [3, 0]
+
+
+def test_region_facets_counts_and_filter_options_are_cached(app, monkeypatch):
+    _add_movements(6)
+    _add_movements(4, start=10, depot_id=2)
+    scope = RegionScope(1, depot_ids=[1])
+    query = StockMovement.query.filter(scope.location_condition(
+        (StockMovement.from_depot_id, StockMovement.to_depot_id)))
+
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    for _ in range(3):
+        assert movement_listing.movement_facets(scope)['by_type']['reception'] == 6
+        assert movement_listing.approximate_count(query, scope, {'type': 'reception'}) == (6, False)
+        options = movement_listing.filter_options(scope)
+    assert len(statements) == 2 + 1 + 4  # facettes, comptage, listes : une seule fois
+    assert [depot['name'] for depot in options['depots']] == ['Dépôt A', 'Dépôt B']  # sans utilisateur connecté
+
+    # Sans filtre, total exact de la table journalière
+    assert movement_listing.approximate_count(StockMovement.query, UNRESTRICTED_SCOPE, {}) == (10, False)
+
+    # Comptage plafonné
+    monkeypatch.setattr(movement_listing, 'COUNT_CAP', 5)
+    assert movement_listing.approximate_count(query, scope, {'search': 'x'}) == (5, True)
+
+    # Un libellé modifié invalide les listes des filtres
+    db.session.get(Depot, 2).name = 'Dépôt Kindia'
+    db.session.commit()
+    options = movement_listing.filter_options(scope)
+    assert [depot['name'] for depot in options['depots']] == ['Dépôt A', 'Dépôt Kindia']
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la saisie rapide des ventes par lot (promotion.save_quick_sales_batch)
+"""
+
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from models import (db, PromotionTeam, PromotionMember, PromotionGamme, PromotionSale,
+                    PromotionTeamStock, PromotionMemberStock, PromotionStockMovement)
+import schema_registry
+from promotion import save_quick_sales_batch
+
+
+@pytest.fixture
+def app(app, seed):
+    schema_registry.reset()
+    seed.user(username='saisie')
+    db.session.add_all([
+        PromotionTeam(id=1, name='Équipe Kaloum', team_leader_id=1),
+        PromotionGamme(id=1, name='Gamme A', selling_price_gnf=10000, commission_per_unit_gnf=1500),
+        PromotionGamme(id=2, name='Gamme B', selling_price_gnf=5000, commission_per_unit_gnf=500),
+    ])
+    db.session.add_all([PromotionMember(id=i, full_name=f'Membre {i}', team_id=1) for i in range(1, 21)])
+    db.session.add_all([
+        PromotionTeamStock(id=1, team_id=1, gamme_id=1, quantity=100),
+        PromotionTeamStock(id=2, team_id=1, gamme_id=2, quantity=3),
+        PromotionMemberStock(id=1, member_id=1, gamme_id=1, quantity=2),
+    ])
+    db.session.commit()
+    schema_registry.load()
+    yield app
+    schema_registry.reset()
+
+
+def _entry(line, member_id, gamme_id, quantity, transaction_type='enlevement'):
+    return {'line': line, 'member_id': member_id, 'gamme_id': gamme_id, 'quantity': quantity,
+            'sale_date': date(2026, 3, 2), 'transaction_type': transaction_type}
+
+
+def _member_stock(member_id, gamme_id):
+    stock = PromotionMemberStock.query.filter_by(member_id=member_id, gamme_id=gamme_id).first()
+    return stock.quantity if stock else None
+
+
+def test_batch_validates_in_order_and_writes_everything(app):
+    saved, errors = save_quick_sales_batch([
+        _entry(1, 1, 1, 5),
+        _entry(2, 1, 1, 6, 'retour'),   # 2 + 5 = 7 disponibles
+        _entry(3, 1, 1, 2, 'retour'),   # 1 restant : refusé
+        _entry(4, 2, 2, 4),             # équipe : 3 disponibles, refusé
+        _entry(5, 2, 2, 3),
+        _entry(6, 99, 1, 1),            # membre inconnu
+    ], recorded_by_id=1)
+
+    assert saved == 3
+    assert [error.split(':')[0].lstrip('⚠️ ') for error in errors] == ['Entrée 3', 'Entrée 4', 'Entrée 6']
+    assert _member_stock(1, 1) == 1 and _member_stock(2, 2) == 3
+
+    today = date.today().strftime('%Y%m%d')
+    sales = PromotionSale.query.order_by(PromotionSale.id).all()
+    assert [sale.reference for sale in sales] == [f'ENL-{today}-0001', f'RET-{today}-0001', f'ENL-{today}-0002']
+    assert sales[0].total_amount_gnf == 50000 and sales[0].commission_gnf == 7500
+
+    movements = PromotionStockMovement.query.order_by(PromotionStockMovement.id).all()
+    assert [(m.movement_type, m.quantity_change, m.quantity) for m in movements] == [
+        ('enlevement', 5, 7), ('retour', -6, 1), ('enlevement', 3, 3)]
+    assert movements[0].sale_id == sales[0].id and movements[1].sale_id is None
+    assert movements[1].from_member_id == 1 and movements[2].to_member_id == 2
+
+
+def test_batch_query_count_does_not_grow_and_failure_rolls_back(app):
+    save_quick_sales_batch([_entry(1, 20, 1, 1)], recorded_by_id=1)  # crée le compteur de références du jour
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        save_quick_sales_batch([_entry(1, 3, 1, 1), _entry(2, 4, 1, 1)], recorded_by_id=1)
+        small = len(statements)
+        statements.clear()
+        save_quick_sales_batch([_entry(i, 5 + i, 1, 1) for i in range(15)], recorded_by_id=1)
+        assert len(statements) == small
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    # Une erreur d'écriture annule tout le lot (références, ventes et stocks)
+    sales_before = PromotionSale.query.count()
+    with pytest.raises(Exception):
+        save_quick_sales_batch([_entry(1, 1, 1, 1), _entry(2, 2, 1, 1)], recorded_by_id=None)
+    db.session.rollback()
+    assert PromotionSale.query.count() == sales_before
+    assert _member_stock(1, 1) == 2 and _member_stock(2, 1) is None
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du calcul en masse des ventes réalisées (realized_sales)
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+from models import (
+    db, StockItem, DepotStock, Forecast, ForecastItem,
+    StockOutgoing, StockOutgoingDetail
+)
+import realized_sales
+
+START = date(2026, 7, 1)
+END = date(2026, 9, 30)
+
+
+@pytest.fixture
+def app(app, seed):
+    seed.family(name='Famille')
+    seed.depot(1, 'Dépôt')
+    db.session.commit()
+    return app
+
+
+def _seed(lines_count):
+    """Prévision de `lines_count` lignes ; chaque article a deux sorties terminées et une brouillon"""
+    db.session.add(Forecast(id=1, name='T3', start_date=START, end_date=END, status='active'))
+    for i in range(1, lines_count + 1):
+        db.session.add(StockItem(id=i, sku=f'SKU-{i}', name=f'Article {i}', family_id=1))
+        db.session.add(ForecastItem(id=i, forecast_id=1, stock_item_id=i, forecast_quantity=Decimal('10')))
+        db.session.add(DepotStock(id=i, depot_id=1, stock_item_id=i, quantity=Decimal('7')))
+    outgoings = [
+        (1, datetime(2026, 7, 15, 10), 'completed'),
+        (2, datetime(2026, 9, 30, 17), 'completed'),   # dernier jour inclus
+        (3, datetime(2026, 8, 1), 'draft'),
+        (4, datetime(2026, 10, 1), 'completed'),        # hors période
+    ]
+    detail_id = 1
+    for outgoing_id, outgoing_date, status in outgoings:
+        db.session.add(StockOutgoing(id=outgoing_id, reference=f'SO-{outgoing_id}', client_name='Client',
+                                     outgoing_date=outgoing_date, status=status))
+        for i in range(1, lines_count + 1):
+            db.session.add(StockOutgoingDetail(id=detail_id, outgoing_id=outgoing_id, stock_item_id=i,
+                                               quantity=Decimal('3'), unit_price_gnf=Decimal('1000')))
+            detail_id += 1
+    db.session.commit()
+
+
+def _count_queries(func, *args):
+    statements = []
+    listener = lambda conn, cursor, statement, *a: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        result = func(*args)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    return result, len(statements)
+
+
+def test_windows_and_forecast_lines_agree(app):
+    _seed(3)
+    windows = realized_sales.realized_sales([(1, START, END), (2, START, date(2026, 7, 31)), (99, START, END)])
+    assert windows[(1, START, END)] == {'total_quantity': 6.0, 'avg_quantity': 3.0, 'total_value': 6000.0, 'count': 2}
+    assert windows[(2, START, date(2026, 7, 31))]['count'] == 1
+    assert windows[(99, START, END)]['count'] == 0
+
+    by_line = realized_sales.realized_sales_for_forecasts([1])
+    assert by_line[1] == windows[(1, START, END)]
+    assert realized_sales.realized_value_by_forecast([1]) == {1: Decimal('18000')}
+    assert realized_sales.stock_available_by_item([1, 2])[1] == Decimal('7')
+
+
+@pytest.mark.parametrize('lines_count', [5, 50, 200])
+def test_query_count_constant_with_forecast_lines(app, lines_count):
+    _seed(lines_count)
+    forecast = db.session.get(Forecast, 1)
+    item_ids = [item.stock_item_id for item in forecast.items]
+
+    realizations, queries = _count_queries(realized_sales.realized_sales_for_forecasts, [1])
+    assert len(realizations) == lines_count
+    assert queries == 1
+
+    _, queries = _count_queries(realized_sales.realized_sales, [(i, START, END) for i in item_ids])
+    assert queries == 1
+
+    _, queries = _count_queries(realized_sales.stock_available_by_item, item_ids)
+    assert queries == 2
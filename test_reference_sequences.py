@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de l'attribution des références de documents (reference_sequences)
+"""
+
+import threading
+from datetime import date, datetime, UTC
+
+import pytest
+from sqlalchemy import event
+
+from models import db, User, StockMovement, StockItem, Family
+import reference_sequences
+import schema_registry
+
+DAY = date(2026, 3, 2)
+
+
+@pytest.fixture
+def app(app):
+    schema_registry.reset()
+    schema_registry.load()
+    yield app
+    schema_registry.reset()
+
+
+def _count_statements():
+    statements = []
+    lock = threading.Lock()
+
+    def listener(conn, cursor, statement, *args):
+        with lock:
+            statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    return statements, lambda: event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+def test_counter_starts_after_existing_references_and_reserves_blocks(app):
+    db.session.add_all([
+        User(id=1, username='stock', email='stock@example.com', password_hash='x'),
+        Family(id=1, name='Froid'),
+        StockItem(id=1, sku='FRG-1', name='Réfrigérateur', family_id=1),
+    ])
+    db.session.add_all([
+        StockMovement(id=i, reference=ref, movement_type='transfer', stock_item_id=1, quantity=1,
+                      user_id=1, movement_date=datetime(2026, 3, 2, tzinfo=UTC))
+        for i, ref in enumerate(['TRANS-20260302-0007-OUT', 'TRANS-20260302-0012-IN',
+                                 'TRANS-20260301-0099', 'REC-20260302-0040'], start=1)
+    ])
+    db.session.commit()
+
+    assert reference_sequences.peek_reference('TRANS', DAY) == 'TRANS-20260302-0013'
+    assert reference_sequences.next_reference('TRANS', DAY) == 'TRANS-20260302-0013'
+    assert reference_sequences.reserve_references('TRANS', 3, DAY) == [
+        'TRANS-20260302-0014', 'TRANS-20260302-0015', 'TRANS-20260302-0016']
+    # Préfixe sans document existant, autre jour : compteurs indépendants
+    assert reference_sequences.next_reference('CMD', DAY) == 'CMD-20260302-0001'
+    assert reference_sequences.next_reference('TRANS', date(2026, 3, 3)) == 'TRANS-20260303-0001'
+
+    # Coût : une instruction par réservation, quelle que soit la taille du bloc
+    statements, stop = _count_statements()
+    try:
+        reference_sequences.next_reference('TRANS', DAY)
+        reference_sequences.reserve_references('TRANS', 500, DAY)
+    finally:
+        stop()
+    assert len(statements) == 2
+
+
+def test_concurrent_allocation_has_no_duplicates(app):
+    threads_count, per_thread, block_size = 8, 25, 10
+    results = [[] for _ in range(threads_count + 1)]
+    barrier = threading.Barrier(threads_count + 1)
+    failures = []
+
+    def allocate_one_by_one(index):
+        with app.app_context():
+            try:
+                barrier.wait()
+                for _ in range(per_thread):
+                    results[index].append(reference_sequences.next_reference('ENL', DAY))
+            except Exception as e:
+                failures.append(e)
+            finally:
+                db.session.remove()
+
+    def allocate_blocks():
+        with app.app_context():
+            try:
+                barrier.wait()
+                for _ in range(per_thread // 5):
+                    results[threads_count].extend(reference_sequences.reserve_references('ENL', block_size, DAY))
+            except Exception as e:
+                failures.append(e)
+            finally:
+                db.session.remove()
+
+    statements, stop = _count_statements()
+    try:
+        workers = [threading.Thread(target=allocate_one_by_one, args=(i,)) for i in range(threads_count)]
+        workers.append(threading.Thread(target=allocate_blocks))
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        stop()
+
+    assert failures == []
+    references = [reference for thread_results in results for reference in thread_results]
+    expected_count = threads_count * per_thread + (per_thread // 5) * block_size
+    assert len(references) == len(set(references)) == expected_count
+    # Aucun trou : les numéros vont de 1 au total attribué
+    assert sorted(int(reference.rsplit('-', 1)[1]) for reference in references) == list(range(1, expected_count + 1))
+    # Chaque thread reçoit ses numéros dans l'ordre croissant
+    assert all(thread_results == sorted(thread_results) for thread_results in results)
+
+    # Coût par référence : une instruction par réservation, plus la création du compteur du jour
+    reservations = threads_count * per_thread + per_thread // 5
+    print(f"\n{len(references)} références, {len(statements)} instructions "
+          f"({len(statements) / len(references):.2f} par référence)")
+    assert len(statements) <= reservations + 2 * (threads_count + 1)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du périmètre régional mis en cache (utils_region_filter.get_region_scope)
+"""
+
+from contextlib import contextmanager
+
+import pytest
+from flask_login import login_user
+from sqlalchemy import event
+
+from models import db, User, Depot, StockMovement
+import utils_region_filter
+from utils_region_filter import (get_region_scope, get_region_location_ids, can_access_depot,
+                                 filter_stock_movements_by_region)
+
+
+@pytest.fixture
+def app(app, seed):
+    utils_region_filter._store.local.clear()
+    seed.role()
+    seed.region(1, 'Conakry')
+    seed.region(2, 'Kindia')
+    seed.family()
+    seed.stock_items([1])
+    db.session.flush()
+    seed.user(1, 'commercial', role_id=1, region_id=1)
+    seed.user(2, 'chauffeur', role_id=1, region_id=1)
+    seed.depot(1, 'Dépôt Conakry', region_id=1)
+    seed.depot(2, 'Dépôt Kindia', region_id=2)
+    db.session.flush()
+    seed.vehicle(plate_number='RC-0001', current_user_id=2)
+    db.session.add_all([
+        StockMovement(id=1, movement_type='transfer', stock_item_id=1, quantity=5, user_id=1,
+                      from_depot_id=2, to_vehicle_id=1),
+        StockMovement(id=2, movement_type='transfer', stock_item_id=1, quantity=5, user_id=1,
+                      from_depot_id=2, to_depot_id=2),
+    ])
+    db.session.commit()
+    yield app
+    utils_region_filter._store.local.clear()
+
+
+@contextmanager
+def _request(app, user_id=1):
+    """Requête HTTP simulée : contexte d'application propre (g et session neufs)"""
+    with app.app_context(), app.test_request_context():
+        login_user(db.session.get(User, user_id))
+        utils_region_filter.get_user_region_id()
+        yield
+
+
+def _count_statements():
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    return statements
+
+
+def _visible_movements():
+    return sorted(m.id for m in filter_stock_movements_by_region(StockMovement.query).all())
+
+
+def test_scope_is_loaded_once_and_shared_between_requests(app):
+    statements = _count_statements()
+    with _request(app):
+        statements.clear()
+        scope = get_region_scope()
+        assert (scope.region_id, scope.depot_ids, scope.vehicle_ids) == (1, {1}, {1})
+        assert get_region_scope() is scope
+        assert get_region_location_ids() == ([1], [1])
+        assert can_access_depot(1) and not can_access_depot(2)
+        assert len(statements) == 2  # dépôts + véhicules, une seule fois
+
+    with _request(app):
+        statements.clear()
+        for _ in range(5):
+            get_region_scope()
+            can_access_depot('1')
+        assert statements == []  # cache partagé entre requêtes
+
+        # Les filtres n'embarquent plus de listes d'identifiants littérales
+        assert _visible_movements() == [1]
+        assert len(statements) == 1
+
+
+def test_scope_is_invalidated_when_a_depot_changes_region(app):
+    with _request(app):
+        assert not can_access_depot(2) and _visible_movements() == [1]
+
+    # Une mise à jour sans lien avec le périmètre ne l'invalide pas
+    generation = utils_region_filter._store.generation()
+    db.session.get(User, 2).username = 'chauffeur-1'
+    db.session.commit()
+    assert utils_region_filter._store.generation() == generation
+
+    db.session.get(Depot, 2).region_id = 1
+    db.session.commit()
+    with _request(app):
+        assert get_region_scope().depot_ids == {1, 2}
+        assert can_access_depot(2) and _visible_movements() == [1, 2]
+
+    # Le chauffeur change de région : son véhicule sort du périmètre
+    db.session.get(User, 2).region_id = 2
+    db.session.commit()
+    with _request(app):
+        assert get_region_scope().vehicle_ids == frozenset()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de l'envoi des rapports planifiés (scheduled_reports) avec une API Message Pro simulée
+"""
+
+import threading
+import time
+from io import BytesIO
+
+import pytest
+
+from models import db, ScheduledReport
+import scheduled_reports
+from scheduled_reports import scheduled_reports_manager
+
+
+class FakeAPI:
+    """Envoi lent (50 ms) ; +2246200000xx en échec au premier essai si xx pair, 99 toujours en échec"""
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.Lock()
+        self.sends, self.contact_pages, self.active, self.max_active = [], 0, 0, 0
+
+    def send_whatsapp(self, recipient, document_file, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            attempt = sum(1 for sent in self.sends if sent == recipient) + 1
+            self.sends.append(recipient)
+        assert document_file[1].read().startswith(b'%PDF')
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        if recipient.endswith('99') or (attempt == 1 and int(recipient[-2:]) % 2 == 0):
+            return {'status': 500, 'message': f'Refusé ({recipient})'}
+        return {'status': 200, 'data': {'messageId': recipient}}
+
+    def get_contacts(self, limit=10, page=1):
+        self.contact_pages += 1
+        contacts = [{'phone': f'+224621{i:06d}', 'groups': [{'id': 7, 'name': 'Chauffeurs'}]}
+                    for i in range(limit)] if page == 1 else []
+        contacts.append({'phone': '+224620000150', 'groups': '7,8'})
+        return {'status': 200, 'data': contacts}
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(scheduled_reports, 'DELIVERY_RETRY_DELAY', 0)
+    monkeypatch.setattr(scheduled_reports, 'DELIVERY_CONCURRENCY', 8)
+    scheduled_reports.clear_group_cache()
+    yield
+    scheduled_reports.clear_group_cache()
+
+
+def test_fan_out_is_concurrent_and_retries_each_recipient():
+    api = FakeAPI()
+    recipients = [f'+2246200000{i:02d}' for i in range(40)] + ['+224620000099', ' +224620000001 ']
+    delivery = scheduled_reports_manager.send_report_via_whatsapp(
+        BytesIO(b'%PDF-1.4 rapport'), recipients, 'compte-1', api=api)
+
+    assert (delivery['sent'], delivery['failed']) == (40, 1)
+    assert list(delivery['errors']) == ['+224620000099']
+    assert len(api.sends) == 40 + 20 + scheduled_reports.DELIVERY_ATTEMPTS
+    assert 1 < api.max_active <= 8
+    # 63 envois de 50 ms : bien moins que l'envoi séquentiel (3,15 s)
+    assert delivery['duration_ms'] < 1500
+
+
+def test_group_members_are_cached_between_runs():
+    api = FakeAPI()
+    members = scheduled_reports.group_members(api, ['7'])
+    assert len(members) == 501 and members[-1] == '+224620000150'
+    assert scheduled_reports.group_members(api, ['8', '9']) == ['+224620000150']
+    assert api.contact_pages == 2  # une page pleine puis une page partielle, une seule fois
+
+    scheduled_reports.clear_group_cache()
+    scheduled_reports.group_members(api, ['7'])
+    assert api.contact_pages == 4
+
+
+def test_execution_stores_delivery_metrics(app, seed, monkeypatch):
+    monkeypatch.setattr(scheduled_reports, 'MessageProAPI', FakeAPI)
+    monkeypatch.setattr(scheduled_reports_manager, 'app', app)
+    monkeypatch.setattr(scheduled_reports_manager, 'generate_stock_inventory_pdf',
+                        lambda **kwargs: BytesIO(b'%PDF-1.4 inventaire'))
+    seed.user()
+    db.session.add(ScheduledReport(id=1, name='Inventaire', report_type='stock_inventory', schedule='08:00',
+                                   whatsapp_account_id='compte-1', recipients='+224620000001,+224620000099',
+                                   group_ids='8', created_by_id=1))
+    db.session.commit()
+
+    report = db.session.get(ScheduledReport, 1)
+    scheduled_reports_manager.execute_scheduled_report(report)
+    db.session.expire_all()
+    report = db.session.get(ScheduledReport, 1)
+    assert (report.run_count, report.last_sent_count, report.last_failed_count) == (1, 2, 1)
+    assert report.last_duration_ms is not None
+    assert report.last_error.startswith('+224620000099: Refusé')
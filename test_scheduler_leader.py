@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du planificateur des rapports en cluster : bail de leader et stockage partagé des tâches
+"""
+
+import time
+from datetime import datetime, timedelta, UTC
+from types import SimpleNamespace
+
+from apscheduler.schedulers.base import STATE_PAUSED, STATE_RUNNING
+from sqlalchemy import update
+
+from models import db, SchedulerLease
+import scheduled_reports
+from scheduled_reports import ScheduledReportsManager, acquire_lease, release_lease
+
+
+def test_lease_has_a_single_holder_until_it_expires(app):
+    assert acquire_lease('rapports', 'web-1')
+    assert not acquire_lease('rapports', 'web-2')
+    assert acquire_lease('rapports', 'web-1')  # renouvellement
+
+    # web-1 ne renouvelle plus : le bail expire et passe à web-2
+    db.session.execute(update(SchedulerLease).values(expires_at=datetime.now(UTC) - timedelta(seconds=5)))
+    db.session.commit()
+    assert acquire_lease('rapports', 'web-2')
+    assert not acquire_lease('rapports', 'web-1')
+
+    assert not release_lease('rapports', 'web-1')
+    assert release_lease('rapports', 'web-2')
+    assert acquire_lease('rapports', 'web-1')
+
+
+def test_only_the_leader_runs_jobs_planned_by_any_process(app):
+    leader, client = ScheduledReportsManager(app), ScheduledReportsManager(app)
+    try:
+        leader.start(role='auto')
+        client.start(role='client')
+        deadline = time.monotonic() + 5
+        while not leader.is_leader and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert leader.is_leader and leader.scheduler.state == STATE_RUNNING
+        assert not client.is_leader and client.scheduler.state == STATE_PAUSED
+
+        # Planifié depuis un processus client, visible par le leader (stockage partagé)
+        report = SimpleNamespace(id=5, is_active=True, schedule_type='weekly', schedule='MON 18:00')
+        assert client.schedule_report(report)
+        job = leader.scheduler.get_job('report_5')
+        assert job.func_ref == 'scheduled_reports:declencher_rapport' and job.args == (5,)
+        assert db.session.get(SchedulerLease, scheduled_reports.LEASE_NAME).holder == leader.holder
+
+        # Arrêt du leader : le bail est libéré pour un autre processus
+        leader.shutdown()
+        assert acquire_lease(scheduled_reports.LEASE_NAME, client.holder)
+    finally:
+        leader.shutdown()
+        client.shutdown()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du registre des capacités du schéma (schema_registry)
+Le registre ne doit plus interroger le catalogue après chargement
+"""
+
+import sys
+import types
+
+import pytest
+from sqlalchemy import event, text
+
+from models import db
+import schema_registry
+
+
+@pytest.fixture
+def app(app):
+    schema_registry.reset()
+    yield app
+    schema_registry.reset()
+
+
+def test_lookups_answer_from_memory(app):
+    schema_registry.load()
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        assert schema_registry.has_table('promotion_sales')
+        assert schema_registry.has_column('promotion_sales', 'transaction_type')
+        assert not schema_registry.has_column('promotion_sales', 'colonne_inexistante')
+        assert not schema_registry.has_column('table_inexistante', 'id')
+        assert schema_registry.get_columns('simulations')[0] == 'id'
+        assert schema_registry.get_columns('table_inexistante') == []
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert statements == []
+
+
+def test_refresh_after_migration(app):
+    schema_registry.load()
+    assert not schema_registry.has_column('promotion_sales', 'nouvelle_colonne')
+
+    db.session.execute(text("ALTER TABLE promotion_sales ADD COLUMN nouvelle_colonne VARCHAR(20)"))
+    db.session.commit()
+    # Pas de rechargement implicite : le registre reflète le dernier chargement
+    assert not schema_registry.has_column('promotion_sales', 'nouvelle_colonne')
+
+    info = schema_registry.refresh_cluster()
+    assert info['loaded'] and info['tables_count'] > 0
+    assert schema_registry.has_column('promotion_sales', 'nouvelle_colonne')
+
+
+def test_tls_redis_url_is_used_for_the_shared_version(monkeypatch):
+    # rediss:// (Redis managé en TLS) est accepté comme redis://
+    class FakeRedis:
+        @classmethod
+        def from_url(cls, url, **kwargs):
+            client = cls()
+            client.url = url
+            return client
+
+        def ping(self):
+            return True
+
+    monkeypatch.setenv('REDIS_URL', 'rediss://cache.example.com:6380/0')
+    monkeypatch.setitem(sys.modules, 'redis', types.SimpleNamespace(Redis=FakeRedis))
+    monkeypatch.setattr(schema_registry, '_redis', None)
+    monkeypatch.setattr(schema_registry, '_redis_checked', False)
+    assert schema_registry._get_redis().url == 'rediss://cache.example.com:6380/0'
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du moteur de recherche plein texte (search_backend)
+Sous SQLite, le moteur utilisé est l'index inversé en mémoire
+"""
+
+import pytest
+
+from models import db, SearchIndex
+import search_backend
+
+
+@pytest.fixture
+def app(app):
+    search_backend.get_backend().reset()
+    db.session.add_all([
+        SearchIndex(id=1, entity_type='stock_item', entity_id=1, module='stocks',
+                    title='Réfrigérateur Samsung 300L', keywords='froid électroménager',
+                    content='Réfrigérateur combiné'),
+        SearchIndex(id=2, entity_type='stock_item', entity_id=2, module='stocks',
+                    title='Climatiseur LG', keywords='froid',
+                    content='Climatiseur split, idéal avec un réfrigérateur'),
+        SearchIndex(id=3, entity_type='simulation', entity_id=1, module='simulations',
+                    title='Simulation Samsung', keywords='', content='Import de téléviseurs'),
+    ])
+    db.session.commit()
+    yield app
+    search_backend.get_backend().reset()
+
+
+def _ids(results):
+    return [row.id for row, _ in results]
+
+
+def test_accent_insensitive_prefix_and_ranking(app):
+    assert search_backend.get_backend().name == 'memory'
+
+    # Sans accents, en préfixe ; le titre l'emporte sur le contenu
+    results, total = search_backend.search('refrig')
+    assert total == 2
+    assert _ids(results) == [1, 2]
+    assert results[0][1] > results[1][1]
+
+    # Tous les termes sont requis
+    results, total = search_backend.search('froid samsung')
+    assert (total, _ids(results)) == (1, [1])
+
+    # Filtres, titre/mots-clés seulement, pagination
+    assert _ids(search_backend.search('samsung', modules=['simulations'])[0]) == [3]
+    assert search_backend.search('televiseur', fields='head') == ([], 0)
+    results, total = search_backend.search('froid', limit=1, offset=1)
+    assert total == 2 and len(results) == 1
+
+
+def test_index_follows_commits(app):
+    assert search_backend.search('congelateur')[1] == 0
+
+    db.session.add(SearchIndex(id=4, entity_type='stock_item', entity_id=4, module='stocks',
+                               title='Congélateur coffre'))
+    db.session.get(SearchIndex, 2).title = 'Ventilateur LG'
+    db.session.delete(db.session.get(SearchIndex, 3))
+    db.session.commit()
+
+    assert _ids(search_backend.search('congel')[0]) == [4]
+    assert _ids(search_backend.search('climatiseur', fields='head')[0]) == []
+    assert search_backend.search('simulation')[1] == 0
+
+
+def test_sql_backends_build_prefix_queries():
+    assert search_backend.PostgresSearchBackend()._tsquery(['frigo', 'sams'], 'head') == 'frigo:AB & sams:*AB'
+    assert search_backend.MySQLSearchBackend()._boolean_query(['de', 'frigo', 'sa']) == '+frigo +sa*'
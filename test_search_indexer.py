@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de l'alimentation de l'index de recherche (search_indexer)
+"""
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from models import db, StockItem, SearchIndex, SearchReindexJob
+import job_queue
+import search_backend
+import search_indexer
+
+
+@pytest.fixture
+def app(app, seed):
+    search_backend.get_backend().reset()
+    seed.family()
+    db.session.commit()
+    yield app
+    search_backend.get_backend().reset()
+
+
+def _index_rows(entity_type='stock_item'):
+    return db.session.execute(
+        select(SearchIndex.entity_id, SearchIndex.title).where(SearchIndex.entity_type == entity_type)
+        .order_by(SearchIndex.entity_id)
+    ).all()
+
+
+def test_incremental_indexing_follows_commits(app):
+    db.session.add(StockItem(id=1, sku='FRG-300', name='Réfrigérateur 300L', family_id=1))
+    db.session.commit()
+    assert _index_rows() == [(1, 'Réfrigérateur 300L')]
+    assert [row.entity_id for row, _ in search_backend.search('frg')[0]] == [1]
+
+    db.session.get(StockItem, 1).name = 'Congélateur 300L'
+    db.session.commit()
+    assert _index_rows() == [(1, 'Congélateur 300L')]
+    assert search_backend.search('refrigerateur')[1] == 0
+
+    db.session.delete(db.session.get(StockItem, 1))
+    db.session.commit()
+    assert _index_rows() == []
+    assert search_backend.search('congelateur')[1] == 0
+
+
+def test_reindex_job_resumes_from_checkpoint(app, monkeypatch):
+    db.session.add_all([
+        StockItem(id=i, sku=f'SKU-{i}', name=f'Article {i}', family_id=1) for i in range(1, 8)
+    ])
+    db.session.commit()
+    # Index vidé, plus une ligne orpheline
+    db.session.execute(delete(SearchIndex))
+    db.session.add(SearchIndex(entity_type='stock_item', entity_id=999, title='Orphelin', module='stocks'))
+    db.session.commit()
+
+    monkeypatch.setattr(search_indexer, 'CHUNK_SIZE', 3)
+    original_upsert = search_indexer.upsert_documents
+    calls = []
+
+    def failing_upsert(session, entity_type, entities, entity_ids=None):
+        if entity_type == 'stock_item':
+            calls.append(len(entities))
+            if len(calls) == 2:
+                raise RuntimeError('connexion perdue')
+        return original_upsert(session, entity_type, entities, entity_ids)
+
+    monkeypatch.setattr(search_indexer, 'upsert_documents', failing_upsert)
+    job = search_indexer.start_reindex(entity_types=['stock_item'], run_async=False)
+    assert job.status == 'failed'
+    assert (job.last_entity_id, job.processed, job.chunks_done) == (3, {'stock_item': 3}, 1)
+    assert [entity_id for entity_id, _ in _index_rows()] == [1, 2, 3, 999]
+
+    # Reprise : même job, à partir du dernier lot validé
+    monkeypatch.setattr(search_indexer, 'upsert_documents', original_upsert)
+    resumed = search_indexer.start_reindex(entity_types=['stock_item'], run_async=False)
+    assert resumed.id == job.id and resumed.status == 'completed'
+    assert resumed.processed == {'stock_item': 7} and resumed.chunks_done == 3
+    assert [entity_id for entity_id, _ in _index_rows()] == list(range(1, 8))
+    assert db.session.execute(select(func.count(SearchReindexJob.id))).scalar() == 1
+
+    progress = search_indexer.job_progress(resumed)
+    assert progress['percent'] == 100.0 and progress['totals'] == {'stock_item': 7}
+
+
+def test_reindex_runs_as_a_job_queue_task(app, monkeypatch):
+    monkeypatch.setattr(job_queue, 'EMBEDDED_WORKER', False)
+    db.session.add_all([StockItem(id=i, sku=f'SKU-{i}', name=f'Article {i}', family_id=1) for i in range(1, 5)])
+    db.session.commit()
+    db.session.execute(delete(SearchIndex))
+    db.session.commit()
+
+    job = search_indexer.start_reindex(entity_types=['stock_item'])
+    assert job.status == 'pending' and search_indexer.start_reindex(entity_types=['stock_item']).id == job.id
+    assert job_queue.process_available(worker='w1') == 1
+    db.session.refresh(job)
+    assert job.status == 'completed' and job.processed == {'stock_item': 4}
+    assert [entity_id for entity_id, _ in _index_rows()] == [1, 2, 3, 4]
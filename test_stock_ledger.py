@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests du grand livre des soldes de stock (stock_ledger)
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from models import db, StockMovement, StockBalanceLedger
+import stock_ledger
+
+
+def _setup_references(seed):
+    seed.family()
+    [item] = seed.stock_items([1])
+    depot_a, depot_b = seed.depot(1, 'Dépôt A'), seed.depot(2, 'Dépôt B')
+    vehicle = seed.vehicle()
+    db.session.commit()
+    return item, depot_a, depot_b, vehicle
+
+
+_next_movement_id = iter(range(1, 10_000))
+
+
+def _movement(item, movement_type, quantity, date, **locations):
+    return StockMovement(
+        id=next(_next_movement_id),
+        movement_type=movement_type,
+        stock_item_id=item.id,
+        quantity=Decimal(str(quantity)),
+        movement_date=date,
+        **locations
+    )
+
+
+def test_ledger_follows_insert_update_delete(app, seed):
+    item, depot_a, depot_b, vehicle = _setup_references(seed)
+    day1 = datetime(2025, 1, 10, 9, 0)
+    day2 = datetime(2025, 1, 11, 15, 30)
+
+    reception = _movement(item, 'reception', 100, day1, to_depot_id=depot_a.id)
+    transfer_out = _movement(item, 'transfer', -30, day2, from_depot_id=depot_a.id)
+    transfer_in = _movement(item, 'transfer', 30, day2, to_vehicle_id=vehicle.id)
+    db.session.add_all([reception, transfer_out, transfer_in])
+    db.session.commit()
+
+    balances = stock_ledger.get_balances()
+    assert balances[('depot', depot_a.id, item.id)] == Decimal('70')
+    assert balances[('vehicle', vehicle.id, item.id)] == Decimal('30')
+    assert stock_ledger.verify_ledger()['ok']
+
+    # Modification : quantité et emplacement
+    reception.quantity = Decimal('120')
+    reception.to_depot_id = depot_b.id
+    db.session.commit()
+    balances = stock_ledger.get_balances()
+    assert balances[('depot', depot_a.id, item.id)] == Decimal('-30')
+    assert balances[('depot', depot_b.id, item.id)] == Decimal('120')
+    assert stock_ledger.verify_ledger()['ok']
+
+    # Suppression
+    db.session.delete(transfer_out)
+    db.session.commit()
+    balances = stock_ledger.get_balances()
+    assert balances.get(('depot', depot_a.id, item.id), Decimal('0')) == Decimal('0')
+    assert stock_ledger.verify_ledger()['ok']
+
+
+def test_period_flows_and_initial_stock(app, seed):
+    item, depot_a, _, _ = _setup_references(seed)
+    start = datetime(2025, 3, 1)
+    db.session.add_all([
+        _movement(item, 'reception', 50, start - timedelta(days=3), to_depot_id=depot_a.id),
+        _movement(item, 'reception', 20, start + timedelta(hours=5), to_depot_id=depot_a.id),
+        _movement(item, 'adjustment', -5, start + timedelta(days=2), from_depot_id=depot_a.id),
+    ])
+    db.session.commit()
+
+    initial = stock_ledger.get_balances(depot_ids=[depot_a.id], vehicle_ids=[], before=start)
+    assert initial[('depot', depot_a.id, item.id)] == Decimal('50')
+
+    flows = stock_ledger.get_flows(depot_ids=[depot_a.id], vehicle_ids=[], start=start)
+    assert flows[item.id] == {'in': Decimal('20'), 'out': Decimal('5'), 'count': 2}
+
+    by_type = stock_ledger.get_flows(start=start, group_by='location_type')
+    assert by_type[('depot', depot_a.id, 'adjustment')]['out'] == Decimal('5')
+
+
+def test_rebuild_repairs_drift(app, seed):
+    item, depot_a, _, _ = _setup_references(seed)
+    db.session.add(_movement(item, 'reception', 10, datetime(2025, 5, 1), to_depot_id=depot_a.id))
+    db.session.commit()
+
+    # Corrompre le grand livre
+    db.session.query(StockBalanceLedger).update({'quantity_in': Decimal('999')})
+    db.session.commit()
+    report = stock_ledger.verify_ledger()
+    assert not report['ok']
+    assert len(report['mismatches']) == 1
+
+    stock_ledger.rebuild_ledger()
+    assert stock_ledger.verify_ledger()['ok']
+    assert stock_ledger.get_balances()[('depot', depot_a.id, item.id)] == Decimal('10')
+
+
+def test_single_row_transfer_debits_source_and_credits_destination(app, seed):
+    item, depot_a, depot_b, vehicle = _setup_references(seed)
+    day = datetime(2025, 6, 2, 10, 0)
+    db.session.add_all([
+        _movement(item, 'reception', 40, day, to_depot_id=depot_a.id),
+        # Anciennes données : transfert sur une seule ligne, source et destination renseignées
+        _movement(item, 'transfer', 15, day, from_depot_id=depot_a.id, to_depot_id=depot_b.id),
+        _movement(item, 'transfer', 5, day, from_vehicle_id=vehicle.id, to_vehicle_id=vehicle.id),
+    ])
+    db.session.commit()
+
+    expected = {('depot', depot_a.id, item.id): Decimal('25'), ('depot', depot_b.id, item.id): Decimal('15'),
+                ('vehicle', vehicle.id, item.id): Decimal('5')}
+    balances = stock_ledger.get_balances()
+    assert {key: balances[key] for key in expected} == expected
+
+    # Même résultat après la reconstruction (rejeu des mouvements existants au démarrage)
+    stock_ledger.rebuild_ledger()
+    balances = stock_ledger.get_balances()
+    assert {key: balances[key] for key in expected} == expected
+    assert stock_ledger.verify_ledger()['ok']
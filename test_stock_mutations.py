@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests des mutations atomiques de stock (stock_mutations)
+"""
+
+import random
+import threading
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, select
+
+from models import db, StockMovement, DepotStock, VehicleStock
+import analytics
+import dashboard_stats
+import stock_ledger
+import stock_mutations
+from stock_mutations import InsufficientStockError
+
+ITEMS = (1, 2, 3)
+LOCATIONS = [('from_depot_id', 'to_depot_id', 1), ('from_depot_id', 'to_depot_id', 2),
+             ('from_vehicle_id', 'to_vehicle_id', 1)]
+
+
+@pytest.fixture
+def app(app, seed):
+    seed.user(username='magasin')
+    seed.family()
+    seed.depot(1, 'Dépôt A')
+    seed.depot(2, 'Dépôt B')
+    seed.vehicle()
+    seed.stock_items(ITEMS)
+    db.session.commit()
+    stock_mutations.record_movements([
+        {'movement_type': 'reception', 'stock_item_id': item_id, 'quantity': Decimal('100'),
+         'user_id': 1, 'to_depot_id': 1}
+        for item_id in ITEMS
+    ])
+    db.session.commit()
+    return app
+
+
+def _transfer(item_id, quantity, source, destination):
+    from_column, _, from_id = source
+    _, to_column, to_id = destination
+    return [
+        {'movement_type': 'transfer', 'stock_item_id': item_id, 'quantity': -quantity, 'user_id': 1, from_column: from_id},
+        {'movement_type': 'transfer', 'stock_item_id': item_id, 'quantity': quantity, 'user_id': 1, to_column: to_id},
+    ]
+
+
+def _balances():
+    balances = {}
+    for row in DepotStock.query.all():
+        balances[('depot', row.depot_id, row.stock_item_id)] = Decimal(str(row.quantity))
+    for row in VehicleStock.query.all():
+        balances[('vehicle', row.vehicle_id, row.stock_item_id)] = Decimal(str(row.quantity))
+    return {key: value for key, value in balances.items() if value}
+
+
+def _ledger_balances():
+    balances = {}
+    for (location_type, location_id, stock_item_id, _, _), (qty_in, qty_out, _) in stock_ledger.replay_movements().items():
+        key = (location_type, location_id, stock_item_id)
+        balances[key] = balances.get(key, Decimal('0')) + qty_in - qty_out
+    return {key: value for key, value in balances.items() if value}
+
+
+def test_batch_is_checked_in_one_pass_and_cached_rows_are_refreshed(app):
+    depot_stock = DepotStock.query.filter_by(depot_id=1, stock_item_id=1).one()
+    assert depot_stock.quantity == 100
+
+    stock_mutations.record_movements(_transfer(1, Decimal('30'), LOCATIONS[0], LOCATIONS[2]))
+    assert depot_stock.quantity == 70  # instance de session rafraîchie
+    db.session.commit()
+    assert VehicleStock.query.filter_by(vehicle_id=1, stock_item_id=1).one().quantity == 30
+
+    # Deux lignes en défaut : tout est signalé, l'appelant annule le lot
+    with pytest.raises(InsufficientStockError) as error:
+        stock_mutations.record_movements(
+            _transfer(1, Decimal('50'), LOCATIONS[2], LOCATIONS[1])
+            + _transfer(2, Decimal('10'), LOCATIONS[1], LOCATIONS[0])
+            + _transfer(3, Decimal('5'), LOCATIONS[0], LOCATIONS[1])
+        )
+    assert [(s['location_type'], s['location_id'], s['stock_item_id'], s['available'], s['requested'])
+            for s in error.value.shortages] == [('depot', 2, 2, 0, 10), ('vehicle', 1, 1, 30, 50)]
+    db.session.rollback()
+
+    # Ajustement : niveau lu sous verrou puis variation signée
+    key = ('depot', 1, 3)
+    level = stock_mutations.get_levels([key], lock=True)[key]
+    stock_mutations.apply_stock_deltas([stock_mutations.depot_delta(1, 3, Decimal('-120') - level + 100)],
+                                       allow_negative=True)
+    db.session.commit()
+    assert stock_mutations.get_levels([key])[key] == -20
+    assert db.session.execute(select(func.count(StockMovement.id))).scalar() == 5
+    assert stock_ledger.verify_ledger()['ok']
+
+
+def test_bulk_writes_invalidate_dashboard_and_stock_kpis_on_commit(app):
+    dashboard_stats._store.local.clear()
+    analytics._stock_kpis_store.local.clear()
+    transfer = [{'movement_type': 'transfer', 'stock_item_id': 1, 'quantity': Decimal('-5'), 'user_id': 1,
+                 'from_depot_id': 1},
+                {'movement_type': 'transfer', 'stock_item_id': 1, 'quantity': Decimal('5'), 'user_id': 1,
+                 'to_depot_id': 2}]
+
+    # Annulé : rien n'est invalidé
+    stock_mutations.record_movements(transfer)
+    db.session.rollback()
+    assert dashboard_stats._store.generation() == 0
+    assert analytics._stock_kpis_store.generation() == 0
+
+    stock_mutations.record_movements(transfer)
+    db.session.commit()
+    assert dashboard_stats._store.generation() == 1
+    assert analytics._stock_kpis_store.generation() == 1
+
+    stock_mutations.apply_stock_deltas([(stock_ledger.LOCATION_DEPOT, 2, 1, Decimal('-1'))])
+    db.session.commit()
+    assert dashboard_stats._store.generation() == 2
+    assert analytics._stock_kpis_store.generation() == 2
+    dashboard_stats._store.local.clear()
+    analytics._stock_kpis_store.local.clear()
+
+
+def test_concurrent_transfers_do_not_drift_from_ledger(app):
+    threads_count, operations = 8, 40
+    outcomes = {'committed': 0, 'refused': 0}
+    failures = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads_count)
+
+    def worker(seed):
+        generator = random.Random(seed)
+        with app.app_context():
+            try:
+                barrier.wait()
+                for _ in range(operations):
+                    rows = []
+                    for _ in range(generator.randint(1, 3)):
+                        source, destination = generator.sample(LOCATIONS, 2)
+                        rows += _transfer(generator.choice(ITEMS), Decimal(generator.randint(1, 25)), source, destination)
+                    try:
+                        stock_mutations.record_movements(rows)
+                        db.session.commit()
+                        outcome = 'committed'
+                    except InsufficientStockError:
+                        db.session.rollback()
+                        outcome = 'refused'
+                    with lock:
+                        outcomes[outcome] += 1
+            except Exception as e:
+                failures.append(e)
+            finally:
+                db.session.remove()
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads_count)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    assert failures == []
+    assert outcomes['committed'] + outcomes['refused'] == threads_count * operations
+    assert outcomes['committed'] > 0 and outcomes['refused'] > 0
+
+    db.session.expire_all()
+    balances = _balances()
+    assert balances == _ledger_balances()
+    assert all(quantity >= 0 for quantity in balances.values())
+    for item_id in ITEMS:
+        assert sum(quantity for key, quantity in balances.items() if key[2] == item_id) == 100
+    assert stock_ledger.verify_ledger()['ok']
@@ -1,13 +1,38 @@
 # utils_region_filter.py
 # Utilitaires pour filtrer les données par région selon l'utilisateur connecté
+#
+# Le périmètre régional (dépôts et véhicules accessibles) est un objet RegionScope
+# résolu une fois par requête (flask.g) et partagé entre requêtes via le cache de
+# l'application ; un commit qui change un dépôt, un véhicule ou l'affectation d'un
+# conducteur l'invalide (génération incrémentée). Les filtres utilisent ses
+# sous-requêtes SQL plutôt que des listes d'identifiants littérales.
 
+import os
+import time
+
+from flask import g, has_request_context
 from flask_login import current_user
 from models import (
     Depot, Vehicle, User, Region, DepotStock, VehicleStock, StockMovement, 
     PromotionTeam, PromotionMember, PromotionSale, CommercialOrder, CommercialSale, 
     SalesObjective, LockisteTeam, VendeurTeam
 )
-from sqlalchemy import or_
+from sqlalchemy import false, or_, select
+
+from cache_generations import ChangeTracker, GenerationCache
+
+SCOPE_CACHE_PREFIX = 'region_scope_'
+SCOPE_GENERATION_KEY = 'region_scope_generation'
+
+# Durée de vie maximale d'un périmètre en cache (filet de sécurité pour les
+# écritures hors ORM, qui ne déclenchent pas l'invalidation)
+SCOPE_TTL = int(os.getenv('REGION_SCOPE_TTL', '300'))
+
+# Attributs dont la modification change un périmètre régional
+SCOPE_ATTRIBUTES = {Depot: ('region_id',), Vehicle: ('current_user_id',), User: ('region_id',)}
+
+# Entrées en cache (cache partagé de l'application, sinon mémoire du processus)
+_store = GenerationCache(SCOPE_GENERATION_KEY, timeout=SCOPE_TTL)
 
 
 def get_user_region_id():
@@ -23,6 +48,18 @@ def get_user_region_id():
     if not current_user or not current_user.is_authenticated:
         return None
     
+    # Résolu une fois par requête
+    if has_request_context():
+        cached = g.get('_user_region')
+        if cached is not None and cached[0] == current_user.id:
+            return cached[1]
+        region_id = _resolve_user_region_id()
+        g._user_region = (current_user.id, region_id)
+        return region_id
+    return _resolve_user_region_id()
+
+
+def _resolve_user_region_id():
     # ⚠️ RÈGLE FONDAMENTALE : Seuls les admins et superviseurs voient TOUT (pas de filtre par région)
     # Retourner None désactive tous les filtres de région pour l'admin et le superviseur
     # Vérifier le rôle avec gestion d'erreur
@@ -52,6 +89,104 @@ def get_user_region_id():
     return region_id
 
 
+class RegionScope:
+    """
+    Périmètre régional de l'utilisateur connecté
+
+    region_id None : aucun filtre (admin, superviseur). Sinon depot_ids et
+    vehicle_ids (véhicules dont le conducteur est de la région) servent aux
+    contrôles d'accès et aux cas vides ; les conditions SQL passent par des
+    sous-requêtes, identiques d'une requête à l'autre.
+    """
+
+    def __init__(self, region_id=None, depot_ids=(), vehicle_ids=()):
+        self.region_id = region_id
+        self.depot_ids = frozenset(depot_ids)
+        self.vehicle_ids = frozenset(vehicle_ids)
+
+    @property
+    def is_restricted(self):
+        return self.region_id is not None
+
+    def depot_ids_subquery(self):
+        return region_depot_ids_subquery(self.region_id)
+
+    def vehicle_ids_subquery(self):
+        return region_vehicle_ids_subquery(self.region_id)
+
+    def depot_condition(self, *columns):
+        """Une des colonnes désigne un dépôt de la région (faux si la région n'en a aucun)"""
+        if not self.depot_ids:
+            return false()
+        subquery = self.depot_ids_subquery()
+        return or_(*[column.in_(subquery) for column in columns])
+
+    def vehicle_condition(self, *columns):
+        """Une des colonnes désigne un véhicule de la région (faux si la région n'en a aucun)"""
+        if not self.vehicle_ids:
+            return false()
+        subquery = self.vehicle_ids_subquery()
+        return or_(*[column.in_(subquery) for column in columns])
+
+    def location_condition(self, depot_columns=(), vehicle_columns=()):
+        """Dépôt OU véhicule de la région"""
+        conditions = []
+        if depot_columns and self.depot_ids:
+            conditions.append(self.depot_condition(*depot_columns))
+        if vehicle_columns and self.vehicle_ids:
+            conditions.append(self.vehicle_condition(*vehicle_columns))
+        return or_(*conditions) if conditions else false()
+
+    def __repr__(self):
+        return f"<RegionScope region={self.region_id} depots={len(self.depot_ids)} vehicles={len(self.vehicle_ids)}>"
+
+
+UNRESTRICTED_SCOPE = RegionScope()
+
+
+def invalidate_region_scopes():
+    """Rend périmés tous les périmètres en cache (tous processus si le cache est partagé)"""
+    _store.invalidate()
+
+
+def _load_region_scope(region_id):
+    """Périmètre d'une région : cache partagé, sinon deux requêtes sur les identifiants"""
+    key = f'{SCOPE_CACHE_PREFIX}{region_id}'
+    generation = _store.generation()
+    entry = _store.get(key)
+    if entry and entry['generation'] == generation and time.time() - entry['loaded_at'] < SCOPE_TTL:
+        return RegionScope(region_id, entry['depot_ids'], entry['vehicle_ids'])
+
+    from models import db
+    depot_ids = db.session.execute(region_depot_ids_subquery(region_id)).scalars().all()
+    vehicle_ids = db.session.execute(region_vehicle_ids_subquery(region_id)).scalars().all()
+    _store.set(key, {'generation': generation, 'loaded_at': time.time(),
+                     'depot_ids': list(depot_ids), 'vehicle_ids': list(vehicle_ids)})
+    return RegionScope(region_id, depot_ids, vehicle_ids)
+
+
+def get_region_scope():
+    """
+    Périmètre régional de l'utilisateur connecté, résolu une seule fois par requête
+    """
+    region_id = get_user_region_id()
+    if region_id is None:
+        return UNRESTRICTED_SCOPE
+    if has_request_context():
+        scope = g.get('_region_scope')
+        if scope is not None and scope.region_id == region_id:
+            return scope
+    scope = _load_region_scope(region_id)
+    if has_request_context():
+        g._region_scope = scope
+    return scope
+
+
+# Un dépôt, un véhicule ou la région d'un utilisateur a changé : nouvelle génération au commit
+_region_scope_changes = ChangeTracker('region_scope_dirty', invalidate_region_scopes,
+                                      'périmètres régionaux', attributes=SCOPE_ATTRIBUTES)
+
+
 def filter_depots_by_region(query):
     """
     Filtre les dépôts selon la région de l'utilisateur connecté
@@ -156,59 +291,66 @@ def filter_stock_movements_by_region(query):
     - Le véhicule source ou destination appartient à cette région (via son conducteur)
     Les admins voient tous les mouvements
     """
-    region_id = get_user_region_id()
-    if region_id is not None:
-        # Récupérer les IDs des dépôts de la région
-        depot_ids = [d.id for d in Depot.query.filter_by(region_id=region_id).all()]
-        
-        # Récupérer les IDs des véhicules de la région (via leur conducteur)
-        vehicle_ids = []
-        vehicles = Vehicle.query.join(User, Vehicle.current_user_id == User.id).filter(
-            User.region_id == region_id
-        ).all()
-        vehicle_ids = [v.id for v in vehicles]
-        
-        # Filtrer les mouvements liés aux dépôts OU véhicules de la région
-        conditions = []
-        if depot_ids:
-            conditions.append(
-                or_(
-                    StockMovement.from_depot_id.in_(depot_ids),
-                    StockMovement.to_depot_id.in_(depot_ids)
-                )
-            )
-        if vehicle_ids:
-            conditions.append(
-                or_(
-                    StockMovement.from_vehicle_id.in_(vehicle_ids),
-                    StockMovement.to_vehicle_id.in_(vehicle_ids)
-                )
-            )
-        
-        if conditions:
-            # Utiliser or_() pour combiner les conditions dépôts et véhicules
-            query = query.filter(or_(*conditions))
-        else:
-            # Aucun dépôt/véhicule dans la région, retourner une requête vide
-            query = query.filter(False)
+    scope = get_region_scope()
+    if scope.is_restricted:
+        # Mouvements liés aux dépôts OU véhicules de la région (faux si la région n'en a aucun)
+        query = query.filter(scope.location_condition(
+            (StockMovement.from_depot_id, StockMovement.to_depot_id),
+            (StockMovement.from_vehicle_id, StockMovement.to_vehicle_id)
+        ))
     
     return query
 
 
+def get_region_location_ids():
+    """
+    Retourne les IDs des dépôts et véhicules de la région de l'utilisateur connecté
+    (même périmètre que filter_stock_movements_by_region)
+    Retourne (None, None) pour les admins/superviseurs (aucun filtre)
+    """
+    scope = get_region_scope()
+    if not scope.is_restricted:
+        return None, None
+    return sorted(scope.depot_ids), sorted(scope.vehicle_ids)
+
+
+def region_depot_ids_subquery(region_id):
+    """
+    Sous-requête des IDs des dépôts d'une région, à utiliser dans in_()
+    (résolue par la base dans la même requête, sans charger les dépôts)
+    """
+    return select(Depot.id).where(Depot.region_id == region_id)
+
+
+def region_vehicle_ids_subquery(region_id):
+    """Sous-requête des IDs des véhicules d'une région (via leur conducteur)"""
+    return select(Vehicle.id).join(User, Vehicle.current_user_id == User.id)\
+        .where(User.region_id == region_id)
+
+
+def stock_movement_region_condition(region_id):
+    """
+    Condition SQL équivalente à filter_stock_movements_by_region pour une région donnée
+    (dépôt ou véhicule source/destination dans la région)
+    """
+    depot_ids = region_depot_ids_subquery(region_id)
+    vehicle_ids = region_vehicle_ids_subquery(region_id)
+    return or_(
+        StockMovement.from_depot_id.in_(depot_ids),
+        StockMovement.to_depot_id.in_(depot_ids),
+        StockMovement.from_vehicle_id.in_(vehicle_ids),
+        StockMovement.to_vehicle_id.in_(vehicle_ids)
+    )
+
+
 def filter_depot_stocks_by_region(query):
     """
     Filtre les stocks de dépôt selon la région de l'utilisateur connecté
     Les admins voient tous les stocks
     """
-    region_id = get_user_region_id()
-    if region_id is not None:
-        # Récupérer les IDs des dépôts de la région
-        depot_ids = [d.id for d in Depot.query.filter_by(region_id=region_id).all()]
-        
-        if depot_ids:
-            query = query.filter(DepotStock.depot_id.in_(depot_ids))
-        else:
-            query = query.filter(False)
+    scope = get_region_scope()
+    if scope.is_restricted:
+        query = query.filter(scope.depot_condition(DepotStock.depot_id))
     
     return query
 
@@ -219,18 +361,9 @@ def filter_vehicle_stocks_by_region(query):
     Un véhicule appartient à une région si son conducteur appartient à cette région
     Les admins voient tous les stocks
     """
-    region_id = get_user_region_id()
-    if region_id is not None:
-        # Récupérer les IDs des véhicules de la région
-        vehicle_ids = [
-            v.id for v in Vehicle.query.join(User, Vehicle.current_user_id == User.id)
-            .filter(User.region_id == region_id).all()
-        ]
-        
-        if vehicle_ids:
-            query = query.filter(VehicleStock.vehicle_id.in_(vehicle_ids))
-        else:
-            query = query.filter(False)
+    scope = get_region_scope()
+    if scope.is_restricted:
+        query = query.filter(scope.vehicle_condition(VehicleStock.vehicle_id))
     
     return query
 
@@ -265,12 +398,13 @@ def can_access_depot(depot_id):
         if current_user.role.code in ['admin', 'superadmin', 'supervisor']:
             return True
     
-    # Vérifier si le dépôt appartient à la région de l'utilisateur
-    depot = Depot.query.get(depot_id)
-    if not depot:
+    # Vérifier si le dépôt appartient à la région de l'utilisateur (périmètre de la requête)
+    if not getattr(current_user, 'region_id', None):
+        return False
+    try:
+        return int(depot_id) in get_region_scope().depot_ids
+    except (TypeError, ValueError):
         return False
-    
-    return depot.region_id == current_user.region_id if hasattr(current_user, 'region_id') and depot.region_id else False
 
 
 def can_access_vehicle(vehicle_id):
@@ -289,15 +423,12 @@ def can_access_vehicle(vehicle_id):
             return True
     
     # Vérifier si le véhicule appartient à la région de l'utilisateur (via le conducteur)
-    vehicle = Vehicle.query.get(vehicle_id)
-    if not vehicle or not vehicle.current_user_id:
+    if not getattr(current_user, 'region_id', None):
         return False
-    
-    driver = User.query.get(vehicle.current_user_id)
-    if not driver:
+    try:
+        return int(vehicle_id) in get_region_scope().vehicle_ids
+    except (TypeError, ValueError):
         return False
-    
-    return driver.region_id == current_user.region_id if hasattr(current_user, 'region_id') and driver.region_id else False
 
 
 def get_user_accessible_regions():
@@ -374,16 +505,9 @@ def filter_receptions_by_region(query):
     Les admins voient toutes les réceptions
     """
     from models import Reception
-    region_id = get_user_region_id()
-    if region_id is not None:
-        # Récupérer les IDs des dépôts de la région
-        depot_ids = [d.id for d in Depot.query.filter_by(region_id=region_id).all()]
-        
-        if depot_ids:
-            query = query.filter(Reception.depot_id.in_(depot_ids))
-        else:
-            # Aucun dépôt dans la région, retourner une requête vide
-            query = query.filter(False)
+    scope = get_region_scope()
+    if scope.is_restricted:
+        query = query.filter(scope.depot_condition(Reception.depot_id))
     
     return query
 
@@ -395,16 +519,9 @@ def filter_inventory_sessions_by_region(query):
     Les admins et superviseurs voient toutes les sessions
     """
     from models import InventorySession
-    region_id = get_user_region_id()
-    if region_id is not None:
-        # Récupérer les IDs des dépôts de la région
-        depot_ids = [d.id for d in Depot.query.filter_by(region_id=region_id).all()]
-        
-        if depot_ids:
-            query = query.filter(InventorySession.depot_id.in_(depot_ids))
-        else:
-            # Aucun dépôt dans la région, retourner une requête vide
-            query = query.filter(False)
+    scope = get_region_scope()
+    if scope.is_restricted:
+        query = query.filter(scope.depot_condition(InventorySession.depot_id))
     
     return query
 
@@ -468,27 +585,9 @@ def filter_outgoings_by_region(query):
     Les admins et superviseurs voient toutes les sorties
     """
     from models import StockOutgoing
-    region_id = get_user_region_id()
-    if region_id is not None:
-        # Récupérer les IDs des dépôts de la région
-        depot_ids = [d.id for d in Depot.query.filter_by(region_id=region_id).all()]
-        
-        # Récupérer les IDs des véhicules de la région
-        vehicle_ids = [
-            v.id for v in Vehicle.query.join(User, Vehicle.current_user_id == User.id)
-            .filter(User.region_id == region_id).all()
-        ]
-        
-        conditions = []
-        if depot_ids:
-            conditions.append(StockOutgoing.depot_id.in_(depot_ids))
-        if vehicle_ids:
-            conditions.append(StockOutgoing.vehicle_id.in_(vehicle_ids))
-        
-        if conditions:
-            query = query.filter(or_(*conditions))
-        else:
-            query = query.filter(False)
+    scope = get_region_scope()
+    if scope.is_restricted:
+        query = query.filter(scope.location_condition((StockOutgoing.depot_id,), (StockOutgoing.vehicle_id,)))
     
     return query
 
@@ -500,27 +599,9 @@ def filter_returns_by_region(query):
     Les admins et superviseurs voient tous les retours
     """
     from models import StockReturn
-    region_id = get_user_region_id()
-    if region_id is not None:
-        # Récupérer les IDs des dépôts de la région
-        depot_ids = [d.id for d in Depot.query.filter_by(region_id=region_id).all()]
-        
-        # Récupérer les IDs des véhicules de la région
-        vehicle_ids = [
-            v.id for v in Vehicle.query.join(User, Vehicle.current_user_id == User.id)
-            .filter(User.region_id == region_id).all()
-        ]
-        
-        conditions = []
-        if depot_ids:
-            conditions.append(StockReturn.depot_id.in_(depot_ids))
-        if vehicle_ids:
-            conditions.append(StockReturn.vehicle_id.in_(vehicle_ids))
-        
-        if conditions:
-            query = query.filter(or_(*conditions))
-        else:
-            query = query.filter(False)
+    scope = get_region_scope()
+    if scope.is_restricted:
+        query = query.filter(scope.location_condition((StockReturn.depot_id,), (StockReturn.vehicle_id,)))
     
     return query
 